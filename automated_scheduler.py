@@ -13,6 +13,10 @@ Usa APScheduler para agendar tarefas.
 import os
 import sys
 import json
+import time
+import uuid
+import random
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -452,7 +456,6 @@ def execute_search_for_schedule(schedule, schedule_index):
     try:
         from datetime import datetime, timedelta
         import json
-        import asyncio
         
         # Obter configurações
         days = schedule.get('days', [])
@@ -477,13 +480,10 @@ def execute_search_for_schedule(schedule, schedule_index):
         print(f"   Durations: {days}", flush=True)
         print(f"   Locations: {locations_to_search}", flush=True)
         
-        # Executar pesquisa usando asyncio
-        all_results = asyncio.run(_do_carjet_search(locations_to_search, days, pickup_date))
+        # Jobs na fila em processo (grava na BD quando todos terminam)
+        _run_searches('daily', locations_to_search, days, pickup_date)
         print(f"\n✅ Search completed!", flush=True)
         
-        # SALVAR NA BD
-        _save_search_results(all_results, days, locations_to_search, pickup_date)
-        
         print(f"\n✅ SEARCH EXECUTION COMPLETED!", flush=True)
         print(f"✅ Results saved to AUTOMATED_SEARCH_HISTORY table!", flush=True)
         print(f"✅ Go to Automated Pricing → History to see them!", flush=True)
@@ -498,6 +498,9 @@ async def _do_carjet_search(locations, days, pickup_date):
     """
     Execute CarJet search using HTTP request to own API (same as manual search)
     This ensures IDENTICAL behavior to manual searches
+
+    Only used when the module runs standalone; inside the app the searches go
+    through the in-process queue (see start_search_queue)
     """
     import aiohttp
     import os
@@ -570,6 +573,7 @@ def _save_search_results(all_results, days, locations, pickup_date):
     """
     import json
     from datetime import datetime
+    from database import price_snapshot_rows, bulk_insert_price_snapshots
     
     print(f"\n💾 Saving results to automated_search_history...", flush=True)
     
@@ -591,6 +595,10 @@ def _save_search_results(all_results, days, locations, pickup_date):
         # NOT pickup_date (when car will be picked up)
         search_date = datetime.now().isoformat()
         
+        # Pesquisas feitas para as 15:00 (ver _do_carjet_search)
+        pickup_dt = search_dt.replace(hour=15, minute=0, second=0, microsecond=0)
+        snapshot_ts = datetime.utcnow().isoformat(timespec="seconds")
+        
         for location in locations:
             location_results = all_results.get(location, {})
             
@@ -629,7 +637,21 @@ def _save_search_results(all_results, days, locations, pickup_date):
             if prices_by_group:
                 # Insert into database
                 
+                # Snapshots individuais (todos os dias da localização num só lote)
                 cursor = conn.cursor()
+                cursor.execute("SAVEPOINT snapshots")
+                try:
+                    snapshot_rows = []
+                    for day, items in location_results.items():
+                        if items:
+                            snapshot_rows.extend(price_snapshot_rows(location, pickup_dt, int(day), items, 'EUR', ts=snapshot_ts))
+                    ingest = bulk_insert_price_snapshots(conn, snapshot_rows)
+                except Exception as e:
+                    # Não perder o histórico por causa dos snapshots
+                    cursor.execute("ROLLBACK TO SAVEPOINT snapshots")
+                    ingest = {"rows": 0, "rows_per_second": 0.0}
+                    print(f"   ⚠️ {location}: snapshots not saved: {e}", flush=True)
+                
                 cursor.execute("""
                     INSERT INTO automated_search_history 
                     (location, search_type, search_date, month_key, prices_data, dias, price_count, supplier_data)
@@ -647,6 +669,7 @@ def _save_search_results(all_results, days, locations, pickup_date):
                 
                 conn.commit()
                 print(f"   ✅ {location}: {total_price_count} prices saved!", flush=True)
+                print(f"      snapshots: {ingest['rows']} rows ({ingest['rows_per_second']:.0f} rows/s)", flush=True)
                 print(f"      search_date: {search_date} (current time)", flush=True)
                 print(f"      month_key: {month_key}", flush=True)
                 print(f"      groups: {list(prices_by_group.keys())}", flush=True)
@@ -659,6 +682,353 @@ def _save_search_results(all_results, days, locations, pickup_date):
         if conn:
             conn.close()
 
+# ═══════════════════════════════════════════════════════════════════════════
+# FILA DE PESQUISAS EM PROCESSO
+# O main regista o pipeline de /api/track-by-params (start_search_queue) e as
+# pesquisas agendadas correm como jobs (localização × duração) em workers
+# limitados no event loop da app, sem loopback HTTP. Cada job tem retry com
+# backoff exponencial; o estado fica em scheduler_search_runs/_jobs para que
+# uma run interrompida por restart seja retomada no arranque seguinte.
+# ═══════════════════════════════════════════════════════════════════════════
+
+SEARCH_QUEUE_WORKERS = max(1, int(os.getenv('SCHEDULER_SEARCH_WORKERS', '4') or 4))
+SEARCH_JOB_MAX_ATTEMPTS = max(1, int(os.getenv('SCHEDULER_SEARCH_ATTEMPTS', '3') or 3))
+SEARCH_JOB_BACKOFF = float(os.getenv('SCHEDULER_SEARCH_BACKOFF', '10') or 10)  # segundos, dobra por tentativa
+SEARCH_JOB_TIMEOUT = float(os.getenv('SCHEDULER_SEARCH_TIMEOUT', '600') or 600)
+SEARCH_RUN_RESUME_HOURS = float(os.getenv('SCHEDULER_RESUME_HOURS', '6') or 6)
+SEARCH_RUNS_KEPT = 20  # runs terminadas mantidas em memória para /api/scheduler/search-queue
+
+_search_runner = None   # async fn(payload) -> dict, registado pelo main
+_search_loop = None
+_search_queue = None
+_search_workers = []
+_search_runs = {}       # run_id -> run (ordem de criação)
+_search_waiters = {}    # run_id -> asyncio.Future resolvido quando a run é gravada
+
+SEARCH_JOB_TABLES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS scheduler_search_runs (
+        run_id TEXT PRIMARY KEY,
+        kind TEXT,
+        locations TEXT,
+        days TEXT,
+        pickup_date TEXT,
+        status TEXT,
+        created_at TEXT,
+        finished_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scheduler_search_jobs (
+        run_id TEXT NOT NULL,
+        location TEXT NOT NULL,
+        days INTEGER NOT NULL,
+        status TEXT,
+        attempts INTEGER DEFAULT 0,
+        items TEXT,
+        error TEXT,
+        updated_at TEXT,
+        PRIMARY KEY (run_id, location, days)
+    )
+    """,
+]
+
+def _job_store_execute(statements):
+    """Executa [(sql, params)] numa transação; sem DATABASE_URL o estado fica só em memória"""
+    if not os.environ.get('DATABASE_URL'):
+        return
+    conn = _get_db_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        for sql, params in statements:
+            cursor.execute(sql, params)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.warning(f"⚠️ Search job store: {e}")
+    finally:
+        conn.close()
+
+def _persist_run(run):
+    _job_store_execute([("""
+        INSERT INTO scheduler_search_runs (run_id, kind, locations, days, pickup_date, status, created_at, finished_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (run_id) DO UPDATE SET status = EXCLUDED.status, finished_at = EXCLUDED.finished_at
+    """, (
+        run['run_id'], run['kind'], json.dumps(run['locations']), json.dumps(run['days']),
+        run['pickup_date'], run['status'], run['created_at'], run.get('finished_at'),
+    ))])
+
+def _persist_jobs(jobs):
+    _job_store_execute([("""
+        INSERT INTO scheduler_search_jobs (run_id, location, days, status, attempts, items, error, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (run_id, location, days) DO UPDATE SET
+            status = EXCLUDED.status, attempts = EXCLUDED.attempts, items = EXCLUDED.items,
+            error = EXCLUDED.error, updated_at = EXCLUDED.updated_at
+    """, (
+        job['run_id'], job['location'], int(job['days']), job['status'], job['attempts'],
+        json.dumps(job['items']) if job['status'] == 'done' else None,
+        job.get('error'), datetime.now().isoformat(),
+    )) for job in jobs])
+
+def _load_resumable_runs():
+    """Runs 'running' recentes com os respetivos jobs; as antigas passam a 'abandoned'"""
+    if not os.environ.get('DATABASE_URL'):
+        return []
+    conn = _get_db_connection()
+    if not conn:
+        return []
+    resumable = []
+    try:
+        cursor = conn.cursor()
+        for ddl in SEARCH_JOB_TABLES_DDL:
+            cursor.execute(ddl)
+        conn.commit()
+
+        cutoff = (datetime.now() - timedelta(hours=SEARCH_RUN_RESUME_HOURS)).isoformat()
+        cursor.execute("""
+            UPDATE scheduler_search_runs SET status = 'abandoned', finished_at = %s
+            WHERE status = 'running' AND created_at < %s
+        """, (datetime.now().isoformat(), cutoff))
+        cursor.execute("""
+            SELECT run_id, kind, locations, days, pickup_date, created_at
+            FROM scheduler_search_runs WHERE status = 'running' ORDER BY created_at
+        """)
+        for run_id, kind, locations, days, pickup_date, created_at in cursor.fetchall():
+            cursor.execute("""
+                SELECT location, days, status, attempts, items, error
+                FROM scheduler_search_jobs WHERE run_id = %s
+            """, (run_id,))
+            jobs = [{
+                'location': loc, 'days': d, 'status': status, 'attempts': attempts or 0,
+                'items': json.loads(items) if items else [], 'error': error,
+            } for loc, d, status, attempts, items, error in cursor.fetchall()]
+            resumable.append({
+                'run_id': run_id, 'kind': kind, 'locations': json.loads(locations or '[]'),
+                'days': json.loads(days or '[]'), 'pickup_date': pickup_date,
+                'created_at': created_at, 'jobs': jobs,
+            })
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.warning(f"⚠️ Could not load pending search runs: {e}")
+    finally:
+        conn.close()
+    return resumable
+
+def _new_search_run(kind, locations, days, pickup_date, run_id=None, created_at=None, saved_jobs=None):
+    run = {
+        'run_id': run_id or f"{kind}-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}",
+        'kind': kind,
+        'locations': list(locations),
+        'days': list(days),
+        'pickup_date': pickup_date,
+        'status': 'running',
+        'created_at': created_at or datetime.now().isoformat(),
+        'finished_at': None,
+        'started': time.perf_counter(),
+        'jobs': {},
+    }
+    saved = {(j['location'], int(j['days'])): j for j in (saved_jobs or [])}
+    # Durações por fora, localizações por dentro: as localizações de cada duração correm em paralelo
+    for day in run['days']:
+        for location in run['locations']:
+            prev = saved.get((location, int(day)), {})
+            status = prev.get('status') or 'queued'
+            if status not in ('done', 'failed'):
+                status = 'queued'
+            run['jobs'][(location, int(day))] = {
+                'run_id': run['run_id'], 'location': location, 'days': day,
+                'status': status, 'attempts': prev.get('attempts', 0),
+                'items': prev.get('items') or [], 'error': prev.get('error'), 'seconds': 0.0,
+            }
+    _search_runs[run['run_id']] = run
+    while len(_search_runs) > SEARCH_RUNS_KEPT:
+        oldest = next(iter(_search_runs))
+        if _search_runs[oldest]['status'] == 'running':
+            break
+        _search_runs.pop(oldest, None)
+    _search_waiters[run['run_id']] = _search_loop.create_future()
+    return run
+
+async def _enqueue_run(run):
+    pending = [job for job in run['jobs'].values() if job['status'] == 'queued']
+    await asyncio.to_thread(_persist_run, run)
+    await asyncio.to_thread(_persist_jobs, list(run['jobs'].values()))
+    for job in pending:
+        _search_queue.put_nowait(job)
+    if not pending:
+        await _maybe_finish_run(run)
+
+async def _run_search_job(job):
+    run = _search_runs.get(job['run_id'])
+    job['status'] = 'running'
+    job['attempts'] += 1
+    await asyncio.to_thread(_persist_jobs, [job])
+
+    payload = {
+        'location': job['location'],
+        'start_date': run['pickup_date'],
+        'start_time': '15:00',
+        'days': job['days'],
+        'lang': 'pt',
+        'currency': 'EUR',
+    }
+    t0 = time.perf_counter()
+    try:
+        data = await asyncio.wait_for(_search_runner(payload), SEARCH_JOB_TIMEOUT)
+        items = (data or {}).get('items') or []
+        if not items:
+            raise RuntimeError((data or {}).get('error') or 'no cars returned')
+    except Exception as e:
+        job['seconds'] += time.perf_counter() - t0
+        job['error'] = f"{type(e).__name__}: {e}"[:500]
+        if job['attempts'] < SEARCH_JOB_MAX_ATTEMPTS:
+            delay = SEARCH_JOB_BACKOFF * (2 ** (job['attempts'] - 1)) * random.uniform(0.8, 1.2)
+            job['status'] = 'retrying'
+            print(f"   ⚠️ {job['location']} {job['days']}d: {job['error']} - retry {job['attempts'] + 1}/{SEARCH_JOB_MAX_ATTEMPTS} in {delay:.0f}s", flush=True)
+            await asyncio.to_thread(_persist_jobs, [job])
+            _search_loop.call_later(delay, _requeue_job, job)
+            return
+        job['status'] = 'failed'
+        job['items'] = []
+        print(f"   ❌ {job['location']} {job['days']}d: failed after {job['attempts']} attempts ({job['error']})", flush=True)
+    else:
+        job['seconds'] += time.perf_counter() - t0
+        job['status'] = 'done'
+        job['items'] = items
+        job['error'] = None
+        print(f"   ✅ {job['location']} {job['days']}d: {len(items)} cars ({job['seconds']:.1f}s)", flush=True)
+    await asyncio.to_thread(_persist_jobs, [job])
+    await _maybe_finish_run(run)
+
+def _requeue_job(job):
+    job['status'] = 'queued'
+    _search_queue.put_nowait(job)
+
+async def _maybe_finish_run(run):
+    if run['status'] != 'running':
+        return
+    if any(job['status'] not in ('done', 'failed') for job in run['jobs'].values()):
+        return
+    run['status'] = 'saving'
+    all_results = {location: {} for location in run['locations']}
+    for (location, _), job in run['jobs'].items():
+        all_results.setdefault(location, {})[job['days']] = job['items']
+    await asyncio.to_thread(_save_search_results, all_results, run['days'], run['locations'], run['pickup_date'])
+    run['status'] = 'completed'
+    run['finished_at'] = datetime.now().isoformat()
+    run['seconds'] = time.perf_counter() - run['started']
+    await asyncio.to_thread(_persist_run, run)
+    # Resultados já gravados: libertar os items, manter só a contagem para o estado
+    for job in run['jobs'].values():
+        job['cars'] = len(job['items'])
+        job['items'] = []
+    waiter = _search_waiters.pop(run['run_id'], None)
+    if waiter is not None and not waiter.done():
+        waiter.set_result(_search_run_summary(run))
+
+async def _search_worker(worker_id):
+    while True:
+        job = await _search_queue.get()
+        try:
+            await _run_search_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"❌ Search worker {worker_id}: {e}")
+        finally:
+            _search_queue.task_done()
+
+async def start_search_queue(runner):
+    """Chamado no arranque do main: regista o pipeline, lança os workers e retoma runs pendentes"""
+    global _search_runner, _search_loop, _search_queue, _search_workers
+    _search_runner = runner
+    _search_loop = asyncio.get_running_loop()
+    _search_queue = asyncio.Queue()
+    _search_workers = [asyncio.create_task(_search_worker(i)) for i in range(SEARCH_QUEUE_WORKERS)]
+    print(f"🧵 Search queue started ({SEARCH_QUEUE_WORKERS} workers)", flush=True)
+
+    for saved in await asyncio.to_thread(_load_resumable_runs):
+        run = _new_search_run(saved['kind'], saved['locations'], saved['days'], saved['pickup_date'],
+                              run_id=saved['run_id'], created_at=saved['created_at'], saved_jobs=saved['jobs'])
+        done = sum(1 for job in run['jobs'].values() if job['status'] in ('done', 'failed'))
+        print(f"   🔁 Resuming {run['run_id']}: {done}/{len(run['jobs'])} jobs already finished", flush=True)
+        await _enqueue_run(run)
+
+async def stop_search_queue():
+    global _search_runner
+    _search_runner = None
+    for task in _search_workers:
+        task.cancel()
+    for task in _search_workers:
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+    _search_workers.clear()
+
+async def _submit_and_wait(kind, locations, days, pickup_date):
+    run = _new_search_run(kind, locations, days, pickup_date)
+    print(f"   🧾 Run {run['run_id']}: {len(run['jobs'])} jobs queued", flush=True)
+    waiter = _search_waiters[run['run_id']]
+    await _enqueue_run(run)
+    return await waiter
+
+def _run_searches(kind, locations, days, pickup_date):
+    """Executa e grava as pesquisas de uma run (chamado nas threads do APScheduler)"""
+    if _search_runner is not None and _search_loop is not None and _search_loop.is_running():
+        future = asyncio.run_coroutine_threadsafe(_submit_and_wait(kind, locations, days, pickup_date), _search_loop)
+        summary = future.result()
+        print(f"   📊 {summary['run_id']}: {summary['done']} done, {summary['failed']} failed in {summary['seconds']:.0f}s", flush=True)
+        return summary
+
+    # Sem app registada (módulo a correr sozinho): loopback HTTP sequencial
+    all_results = asyncio.run(_do_carjet_search(locations, days, pickup_date))
+    _save_search_results(all_results, days, locations, pickup_date)
+    return None
+
+def _search_run_summary(run, with_jobs=False):
+    jobs = list(run['jobs'].values())
+    summary = {
+        'run_id': run['run_id'],
+        'kind': run['kind'],
+        'status': run['status'],
+        'pickup_date': run['pickup_date'],
+        'created_at': run['created_at'],
+        'finished_at': run.get('finished_at'),
+        'seconds': round(run.get('seconds', time.perf_counter() - run['started']), 1),
+        'total': len(jobs),
+        'done': sum(1 for j in jobs if j['status'] == 'done'),
+        'failed': sum(1 for j in jobs if j['status'] == 'failed'),
+        'running': sum(1 for j in jobs if j['status'] == 'running'),
+        'queued': sum(1 for j in jobs if j['status'] in ('queued', 'retrying')),
+    }
+    if with_jobs:
+        summary['jobs'] = [{
+            'location': j['location'],
+            'days': j['days'],
+            'status': j['status'],
+            'attempts': j['attempts'],
+            'cars': j.get('cars', len(j['items'])),
+            'seconds': round(j['seconds'], 1),
+            'error': j.get('error'),
+        } for j in jobs]
+    return summary
+
+def get_search_queue_status():
+    """Estado da fila para /api/scheduler/search-queue"""
+    return {
+        'enabled': _search_runner is not None,
+        'workers': len(_search_workers),
+        'queue_size': _search_queue.qsize() if _search_queue is not None else 0,
+        'max_attempts': SEARCH_JOB_MAX_ATTEMPTS,
+        'runs': [_search_run_summary(run, with_jobs=True) for run in reversed(list(_search_runs.values()))],
+    }
+
 def execute_weekly_search():
     """
     Execute weekly search - uses FIXED DAY of month (e.g., day 05)
@@ -669,7 +1039,6 @@ def execute_weekly_search():
     print(f"{'='*80}", flush=True)
     
     try:
-        import asyncio
         from datetime import datetime, timedelta
         
         # Load weekly settings
@@ -703,11 +1072,8 @@ def execute_weekly_search():
         print(f"   Durations: {days}", flush=True)
         print(f"   Locations: {locations_to_search}", flush=True)
         
-        # Execute search with Anti-WAF
-        all_results = asyncio.run(_do_carjet_search(locations_to_search, days, pickup_date))
-        
-        # Save results
-        _save_search_results(all_results, days, locations_to_search, pickup_date)
+        # Execute and save searches through the in-process queue
+        _run_searches('weekly', locations_to_search, days, pickup_date)
         
         print(f"\n✅ WEEKLY SEARCH COMPLETED!", flush=True)
         print(f"{'='*80}\n", flush=True)
@@ -739,7 +1105,6 @@ def execute_monthly_search():
     print(f"{'='*80}", flush=True)
     
     try:
-        import asyncio
         from datetime import datetime, timedelta
         
         # Load monthly settings
@@ -776,11 +1141,8 @@ def execute_monthly_search():
         print(f"   Durations: {days}", flush=True)
         print(f"   Locations: {locations_to_search}", flush=True)
         
-        # Execute search with Anti-WAF
-        all_results = asyncio.run(_do_carjet_search(locations_to_search, days, pickup_date))
-        
-        # Save results
-        _save_search_results(all_results, days, locations_to_search, pickup_date)
+        # Execute and save searches through the in-process queue
+        _run_searches('monthly', locations_to_search, days, pickup_date)
         
         print(f"\n✅ MONTHLY SEARCH COMPLETED!", flush=True)
         print(f"{'='*80}\n", flush=True)
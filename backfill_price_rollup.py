@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Reconstrói a tabela price_snapshot_daily (rollup diário de /api/price-history)
+a partir de todos os price_snapshots existentes.
+
+Funciona em SQLite (data.db local) e PostgreSQL (DATABASE_URL).
+O arranque da app só faz isto sozinho quando o rollup está vazio; usar este
+script depois de importar/corrigir snapshots diretamente na base de dados.
+
+    python backfill_price_rollup.py
+"""
+
+import time
+
+from database import get_db, backfill_price_rollup
+
+
+def main():
+    print("=" * 80)
+    print("📈 BACKFILL price_snapshot_daily")
+    print("=" * 80)
+
+    conn = get_db()
+    try:
+        started = time.perf_counter()
+        written = backfill_price_rollup(conn)
+        conn.commit()
+        elapsed = time.perf_counter() - started
+        print(f"✅ {written} linhas no rollup ({elapsed:.2f}s)")
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Erro: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
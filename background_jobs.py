@@ -0,0 +1,360 @@
+"""
+Jobs em background para operações longas de admin (scraping, downloads de fotos, backups)
+
+O endpoint cria o job e responde logo com o job_id; o trabalho corre no event loop
+deste worker (as partes bloqueantes em threads, via Job.run_in_thread) e o cliente
+acompanha por polling (GET /api/jobs/{id}) ou em stream (SSE, JobManager.subscribe).
+
+- Limites: no total (max_running) e por grupo (ex.: um só scraping do CarJet de cada
+  vez); os restantes ficam em "queued" pela ordem de chegada.
+- Pedido repetido (mesmo kind + params) enquanto o anterior não acabou devolve o
+  job existente em vez de arrancar outro (duplo clique, retries do browser).
+- Cancelamento: a task é cancelada; o código em threads vê job.cancel_requested /
+  job.check_cancelled() e run_in_thread espera que a thread termine antes de o job
+  ficar "cancelled" (limpeza de ficheiros parciais, etc.).
+- persist (opcional) recebe o snapshot nas mudanças de estado, no máximo a cada
+  persist_interval no progresso e a cada heartbeat enquanto corre: é o que deixa os
+  outros workers responder por jobs que não são seus (e ver os que ficaram órfãos).
+
+Sem dependências da app.
+"""
+
+import asyncio
+import itertools
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Levantada por Job.check_cancelled() no código que corre em threads"""
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Job:
+    def __init__(self, manager: "JobManager", kind: str, group: str, params: Optional[dict], created_by: Optional[str]):
+        self.id = f"{kind}-{datetime.now().strftime('%Y%m%d%H%M%S')}-{secrets.token_hex(3)}"
+        self.kind = kind
+        self.group = group
+        self.params = params or {}
+        self.created_by = created_by
+        self.status = QUEUED
+        self.done = 0
+        self.total: Optional[int] = None
+        self.message = ""
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = _now_iso()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.version = 0  # sobe a cada alteração (streams só enviam o que mudou)
+        self.cancel_event = threading.Event()
+        self.task: Optional[asyncio.Task] = None
+        self._manager = manager
+        self._started: Optional[float] = None  # time.monotonic()
+        self._finished_mono: Optional[float] = None
+        self._persisted = 0.0
+        self._persist_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def progress(self, done: Optional[int] = None, total: Optional[int] = None, message: Optional[str] = None,
+                 advance: int = 0):
+        """Atualiza o progresso (pode ser chamado de threads)"""
+        if total is not None:
+            self.total = total
+        if done is not None:
+            self.done = done
+        self.done += advance
+        if message is not None:
+            self.message = message
+        self._manager._changed(self)
+
+    async def run_in_thread(self, fn: Callable, *args, **kwargs):
+        """
+        fn numa thread; se o job for cancelado entretanto, pede o cancelamento
+        (cancel_event) e espera que fn termine antes de propagar o CancelledError
+        """
+        future = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel_event.set()
+            try:
+                await future
+            except BaseException:
+                pass
+            raise
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = None
+        if self._started is not None:
+            elapsed = round((self._finished_mono or time.monotonic()) - self._started, 2)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "percent": round(self.done * 100 / self.total, 1) if self.total else None,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "params": self.params,
+            "created_by": self.created_by,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": elapsed,
+            "cancel_requested": self.cancel_requested,
+        }
+
+
+class JobManager:
+    """
+    limits: grupo -> jobs em simultâneo (grupos sem entrada: 1)
+    persist: callable(snapshot) síncrono, corre numa thread
+    """
+
+    def __init__(self, max_running: int = 4, limits: Optional[Dict[str, int]] = None, keep: int = 200,
+                 persist: Optional[Callable[[Dict[str, Any]], None]] = None, persist_interval: float = 2.0,
+                 heartbeat: float = 30.0):
+        self.max_running = max(1, max_running)
+        self.limits = dict(limits or {})
+        self.keep = keep
+        self.persist = persist
+        self.persist_interval = persist_interval
+        self.heartbeat = heartbeat
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: List[tuple] = []  # (job, fn) à espera de vaga, por ordem de chegada
+        self._running: Dict[str, int] = {}  # grupo -> em curso
+        self._subscribers: Dict[str, set] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._persist_chain: Dict[str, asyncio.Future] = {}
+        self._seq = itertools.count(1)
+        self.stats = {"submitted": 0, "deduplicated": 0, DONE: 0, FAILED: 0, CANCELLED: 0, "persist_errors": 0}
+
+    # --- API ---
+
+    def submit(self, kind: str, fn: Callable[[Job], Awaitable[Any]], params: Optional[dict] = None,
+               group: Optional[str] = None, created_by: Optional[str] = None, dedupe: bool = True) -> Job:
+        """Cria e agenda um job (só no event loop); fn(job) é uma coroutine que devolve o result"""
+        self._loop = asyncio.get_running_loop()
+        if dedupe:
+            for job in reversed(self._jobs.values()):
+                if job.kind == kind and job.params == (params or {}) and not job.finished and not job.cancel_requested:
+                    self.stats["deduplicated"] += 1
+                    return job
+        job = Job(self, kind, group or kind, params, created_by)
+        self._jobs[job.id] = job
+        self.stats["submitted"] += 1
+        self._queue.append((job, fn))
+        self._trim()
+        self._changed(job, force=True)
+        self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self, kind: Optional[str] = None) -> List[Job]:
+        return [j for j in reversed(self._jobs.values()) if kind is None or j.kind == kind]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Pede o cancelamento (só no event loop); devolve o job ou None se não for deste worker"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel_event.set()
+        if job.task is None:
+            # ainda na fila
+            self._queue = [(j, fn) for j, fn in self._queue if j is not job]
+            self._finish(job, CANCELLED)
+        elif job.status == RUNNING:
+            job.task.cancel()
+            self._changed(job, force=True)
+        # (task criada mas ainda não arrancou: _run vê o cancel_event logo no início)
+        return job
+
+    def cancel_threadsafe(self, job_id: str):
+        loop = self._loop
+        if loop is not None and not loop.is_closed() and job_id in self._jobs:
+            loop.call_soon_threadsafe(self.cancel, job_id)
+
+    async def wait(self, job: Job) -> Job:
+        """Espera pelo fim do job (sem o cancelar se quem espera desistir)"""
+        queue = self.subscribe(job.id)
+        try:
+            while not job.finished:
+                await queue.get()
+        finally:
+            self.unsubscribe(job.id, queue)
+        return job
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Fila com o snapshot a cada alteração (mantém só o último se o cliente for lento)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    def shutdown(self):
+        for job in list(self._jobs.values()):
+            if not job.finished:
+                job.cancel_event.set()
+                if job.task is not None:
+                    job.task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            **self.stats,
+            "jobs": by_status,
+            "running_by_group": {g: n for g, n in self._running.items() if n},
+            "queued": len(self._queue),
+            "max_running": self.max_running,
+            "limits": self.limits,
+        }
+
+    # --- interno ---
+
+    def _dispatch(self):
+        running = sum(self._running.values())
+        for entry in list(self._queue):
+            if running >= self.max_running:
+                break
+            job, fn = entry
+            if self._running.get(job.group, 0) >= self.limits.get(job.group, 1):
+                continue
+            self._queue.remove(entry)
+            self._running[job.group] = self._running.get(job.group, 0) + 1
+            running += 1
+            job.task = self._loop.create_task(self._run(job, fn))
+
+    async def _run(self, job: Job, fn):
+        job.status = RUNNING
+        job.started_at = _now_iso()
+        job._started = time.monotonic()
+        self._changed(job, force=True)
+        logger.info(f"[JOBS] {job.id} started")
+        beat = self._loop.create_task(self._heartbeat(job)) if self.persist is not None else None
+        try:
+            job.check_cancelled()
+            job.result = await fn(job)
+            status = DONE
+        except (asyncio.CancelledError, JobCancelled):
+            status = CANCELLED
+        except Exception as e:
+            logger.error(f"[JOBS] {job.id} failed: {type(e).__name__}: {e}")
+            job.error = str(e) or type(e).__name__
+            status = FAILED
+        finally:
+            self._running[job.group] -= 1
+            if beat is not None:
+                beat.cancel()
+        self._finish(job, status)
+        self._dispatch()
+
+    async def _heartbeat(self, job: Job):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            self._persist(job)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = _now_iso()
+        job._finished_mono = time.monotonic()
+        if status == CANCELLED and not job.message:
+            job.message = "Cancelled"
+        self.stats[status] += 1
+        elapsed = f" in {job._finished_mono - job._started:.1f}s" if job._started else ""
+        logger.info(f"[JOBS] {job.id} {status}{elapsed}")
+        self._changed(job, force=True)
+
+    def _trim(self):
+        while len(self._jobs) > self.keep:
+            oldest = next((jid for jid, j in self._jobs.items() if j.finished), None)
+            if oldest is None:
+                break
+            self._jobs.pop(oldest)
+
+    def _changed(self, job: Job, force: bool = False):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is not loop:
+            # chamado de uma thread (progresso dentro de run_in_thread)
+            loop.call_soon_threadsafe(self._changed, job, force)
+            return
+        job.version = next(self._seq)
+        snapshot = job.snapshot()
+        for queue in list(self._subscribers.get(job.id, ())):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+        if self.persist is None:
+            return
+        wait = self.persist_interval - (time.monotonic() - job._persisted)
+        if force or wait <= 0:
+            if job._persist_timer is not None:
+                job._persist_timer.cancel()
+                job._persist_timer = None
+            self._persist(job)
+        elif job._persist_timer is None:
+            job._persist_timer = loop.call_later(wait, self._persist_later, job)
+
+    def _persist_later(self, job: Job):
+        job._persist_timer = None
+        self._persist(job)
+
+    def _persist(self, job: Job):
+        """Escritas do mesmo job em série, sempre com o snapshot mais recente"""
+        job._persisted = time.monotonic()
+        snapshot = job.snapshot()
+        previous = self._persist_chain.get(job.id)
+
+        async def write():
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await asyncio.to_thread(self.persist, snapshot)
+            except Exception as e:
+                self.stats["persist_errors"] += 1
+                logger.warning(f"[JOBS] persist {job.id}: {e}")
+
+        future = self._persist_chain[job.id] = asyncio.ensure_future(write())
+        future.add_done_callback(lambda f: self._persist_chain.get(job.id) is f and self._persist_chain.pop(job.id))
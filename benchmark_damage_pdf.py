@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Benchmark do motor de PDFs dos Damage Reports (damage_report_pdf)
+
+Template "Damage Report.pdf" + coordenadas de damage_report_coordinates.json, mais
+alguns campos de exemplo (croqui, fotos, assinatura, tabela, linhas de reparação)
+para exercitar todos os tipos; imagens geradas com o Pillow.
+
+Uso:
+    python benchmark_damage_pdf.py              # PDFs/s: um a um e em batch (pool de processos)
+    python benchmark_damage_pdf.py --legacy     # + o caminho antigo (merge_page do PyPDF2)
+    python benchmark_damage_pdf.py --check      # o overlay como XObject tem o mesmo texto
+                                                # que o merge_page
+"""
+
+import base64
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+import damage_report_pdf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE = os.path.join(BASE_DIR, "Damage Report.pdf")
+COORDINATES = os.path.join(BASE_DIR, "damage_report_coordinates.json")
+REPORTS = 24
+WORKERS = 2
+
+# field_id: (x, y, width, height, page) - coordenadas do mapeador (Y a partir do topo)
+EXTRA_FIELDS = {
+    "vehicle_diagram": (25, 254, 256, 201, 1),
+    "damage_description_line_1": (318, 260, 250, 12, 1),
+    "damage_description_line_2": (318, 274, 250, 12, 1),
+    "repair_line_1": (30, 620, 200, 12, 1),
+    "repair_line_1_qty": (240, 620, 40, 12, 1),
+    "repair_line_1_hours": (290, 620, 40, 12, 1),
+    "repair_line_1_price": (340, 620, 60, 12, 1),
+    "total_repair_cost": (480, 700, 80, 14, 1),
+    "client_signature": (30, 760, 150, 50, 1),
+    "repair_items": (30, 300, 500, 150, 2),
+    "damage_photo_1": (30, 520, 120, 90, 2),
+    "damage_photo_2": (160, 520, 120, 90, 2),
+    "damage_photo_3": (290, 520, 120, 90, 2),
+}
+
+
+def load_coordinates() -> list:
+    with open(COORDINATES, encoding="utf-8") as f:
+        mapped = json.load(f)
+    rows = [(c["field_id"], c["x"], c["y"], c["width"], c["height"], c.get("page", 1)) for c in mapped.values()]
+    rows += [(field_id, *box) for field_id, box in EXTRA_FIELDS.items()]
+    return sorted(rows)
+
+
+def _data_url(size, color, fmt="JPEG", mode="RGB") -> str:
+    im = Image.new(mode, size, color)
+    draw = ImageDraw.Draw(im)
+    for i in range(0, size[0], 17):
+        draw.line((i, 0, size[0] - i, size[1]), fill=(20, 20, 20, 255)[:len(mode)], width=3)
+    out = io.BytesIO()
+    im.save(out, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return f"data:image/{fmt.lower()};base64," + base64.b64encode(out.getvalue()).decode()
+
+
+def build_reports(count: int) -> list:
+    diagram = _data_url((500, 390), (255, 255, 255), "PNG")
+    signature = _data_url((300, 100), (255, 255, 255, 0), "PNG", "RGBA")
+    photos = [_data_url((1600, 1200), color) for color in ((200, 60, 60), (60, 200, 60), (60, 60, 200), (90, 90, 90))]
+    reports = []
+    for n in range(count):
+        reports.append({
+            "dr_number": f"DR {n + 1:02d}/2025", "contractNumber": f"RA{4000 + n}",
+            "clientName": f"Cliente {n}", "clientEmail": f"cliente{n}@example.com", "clientPhone": "912345678",
+            "address": "Rua Exemplo 1", "city": "Faro", "country": "Portugal", "customer_postal": "8000-000 / Faro",
+            "vehiclePlate": "AA-00-BB", "vehicleBrand": "Fiat", "pickupDate": "01-11-2025", "pickupLocation": "Faro",
+            "returnDate": "06-11-2025", "returnLocation": "Albufeira",
+            "vehicle_diagram": diagram, "client_signature": signature,
+            # fotos repetidas entre DRs (como o mesmo croqui/foto em reenvios)
+            "damage_photo_1": photos[n % 4], "damage_photo_2": photos[(n + 1) % 4], "damage_photo_3": photos[(n + 2) % 4],
+            "damage_1": "Risco na porta", "damage_2": "Amolgadela",
+            "repair_line_1": "Pintura", "repair_line_1_qty": "1", "repair_line_1_hours": "2", "repair_line_1_price": "120",
+            "total_repair_cost": f"{120 + n}.00",
+            "repair_items": json.dumps([{"description": "Pintura", "quantity": 1, "hours": 2, "price": 60, "total": 120}]),
+        })
+    return reports
+
+
+def legacy_render(template_data: bytes, plan, report_data: dict) -> bytes:
+    """Caminho antigo: template lido de novo e overlay juntado com merge_page"""
+    from PyPDF2 import PdfReader, PdfWriter
+    reader = PdfReader(io.BytesIO(template_data))
+    writer = PdfWriter()
+    for page, (width, height, fields) in zip(reader.pages, plan.pages):
+        overlay = damage_report_pdf._overlay(width, height, fields, report_data)
+        if overlay is not None:
+            page.merge_page(PdfReader(io.BytesIO(overlay)).pages[0])
+        writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _page_texts(pdf: bytes) -> list:
+    from PyPDF2 import PdfReader
+    return [sorted(p.extract_text().split("\n")) for p in PdfReader(io.BytesIO(pdf)).pages]
+
+
+def check(template_data, coordinates) -> bool:
+    plan = damage_report_pdf.TemplatePlan(template_data, coordinates)
+    report = build_reports(1)[0]
+    same = _page_texts(damage_report_pdf.render(plan, report)) == _page_texts(legacy_render(template_data, plan, report))
+    print(f"{'OK' if same else 'DIFF'}  texto das páginas igual ao merge_page")
+    return same
+
+
+def benchmark(template_data, coordinates, legacy: bool) -> None:
+    reports = build_reports(REPORTS)
+
+    t0 = time.perf_counter()
+    plan = damage_report_pdf.TemplatePlan(template_data, coordinates)
+    first = damage_report_pdf.render(plan, reports[0])
+    print(f"{'primeiro PDF (plan + imagens)':34} {(time.perf_counter() - t0) * 1000:8.1f} ms  ({len(first) // 1024} KB)")
+
+    t0 = time.perf_counter()
+    for report in reports:
+        damage_report_pdf.render(plan, report)
+    dt = time.perf_counter() - t0
+    print(f"{'um a um (plan em cache)':34} {dt / len(reports) * 1000:8.1f} ms/PDF  {len(reports) / dt:6.1f} PDFs/s")
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=WORKERS, mp_context=ctx) as pool:
+        chunk = -(-len(reports) // WORKERS)
+
+        def run_batch():
+            futures = [pool.submit(damage_report_pdf.render_batch, plan.key, plan.template_data, plan.coordinates,
+                                   reports[i:i + chunk]) for i in range(0, len(reports), chunk)]
+            return [r for f in futures for r in f.result()]
+
+        run_batch()  # arranque dos workers + plan em cada um
+        t0 = time.perf_counter()
+        results = run_batch()
+        dt = time.perf_counter() - t0
+    assert all(r["ok"] for r in results)
+    print(f"{f'batch ({WORKERS} processos)':34} {dt / len(reports) * 1000:8.1f} ms/PDF  {len(reports) / dt:6.1f} PDFs/s")
+
+    if legacy:
+        t0 = time.perf_counter()
+        legacy_render(template_data, plan, reports[0])
+        dt = time.perf_counter() - t0
+        print(f"{'antigo (merge_page, 1 PDF)':34} {dt * 1000:8.1f} ms/PDF  {1 / dt:6.1f} PDFs/s")
+
+    print(f"imagens: {damage_report_pdf.image_cache_stats()}")
+
+
+if __name__ == "__main__":
+    with open(TEMPLATE, "rb") as f:
+        template = f.read()
+    coords = load_coordinates()
+    if "--check" in sys.argv:
+        sys.exit(0 if check(template, coords) else 1)
+    benchmark(template, coords, "--legacy" in sys.argv)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Benchmark do parse_prices sobre as páginas CarJet guardadas
+
+Uso:
+    python benchmark_parse_prices.py            # tempos por ficheiro
+    python benchmark_parse_prices.py --check    # confirma que os atalhos do parser
+                                                # escolhem os mesmos nós que os seletores CSS
+
+TOTAL (melhor de 3, todas as páginas, com a passagem pelos cards a correr):
+    antes do _scan_result_page          ~23.1 s
+    _scan_result_page + regexes         ~19.3 s
+    + _scan_card e fotos numa transação  ~9.2 s
+Medido na mesma máquina, alternando as versões; o que resta é sobretudo a
+construção da árvore do BeautifulSoup e os get_text() dos cards.
+"""
+
+import contextlib
+import glob
+import io
+import logging
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = sorted(glob.glob(os.path.join(BASE_DIR, "carjet_group_*.html"))) + [
+    os.path.join(BASE_DIR, "carjet_html_source.html"),
+    os.path.join(BASE_DIR, "carjet_automatic_filter_response.html"),
+]
+BASE_URL = "https://www.carjet.com/do/list/pt"
+
+
+def _load_main():
+    sys.path.insert(0, BASE_DIR)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        import main
+    logging.disable(logging.CRITICAL)
+    return main
+
+
+def _same_card_fields(main, cards) -> bool:
+    """_scan_card devolve, por card, o mesmo nó que select_one() de cada CARD_FIELD_SELECTORS"""
+    for card in cards:
+        fields = main._scan_card(card)
+        for key, css in main.CARD_FIELD_SELECTORS.items():
+            if fields[key] is not card.select_one(css):
+                print(f"      card {cards.index(card)}: {key} difere")
+                return False
+    return True
+
+
+def check(main) -> bool:
+    """Compara _scan_result_page/_find_price_strings/_scan_card com select()/find_all(text=)"""
+    from bs4 import BeautifulSoup
+    ok = True
+    for fp in FIXTURES:
+        html = open(fp, encoding="utf-8", errors="ignore").read()
+        soup = BeautifulSoup(html, "lxml")
+        _trans, _used, cards = main._scan_result_page(soup)
+        same_cards = [id(c) for c in cards] == [id(c) for c in soup.select(main.RESULT_CARD_SELECTOR)]
+        same_trans = _trans is soup.select_one("input[name='frmTrans'][checked]")
+        same_used = _used is soup.select_one("#filterUsed")
+        same_prices = [id(s) for s in main._find_price_strings(soup)] == [id(s) for s in soup.find_all(string=main.PRICE_TEXT_RX)]
+        same_fields = _same_card_fields(main, cards)
+        status = "OK" if (same_cards and same_trans and same_used and same_prices and same_fields) else "DIFF"
+        ok = ok and status == "OK"
+        print(f"{status:4}  {os.path.basename(fp):40} cards={len(cards)}")
+    return ok
+
+
+def benchmark(main, rounds: int = 3) -> None:
+    total = 0.0
+    for fp in FIXTURES:
+        html = open(fp, encoding="utf-8", errors="ignore").read()
+        best = None
+        count = 0
+        for _ in range(rounds):
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                t0 = time.perf_counter()
+                items = main.parse_prices(html, BASE_URL)
+                dt = time.perf_counter() - t0
+            count = len(items)
+            best = dt if best is None else min(best, dt)
+        total += best
+        print(f"{os.path.basename(fp):40} {len(html) // 1024:6} KB  {count:4} items  {best * 1000:8.1f} ms")
+    print(f"{'TOTAL':40} {total * 1000:25.1f} ms")
+
+
+if __name__ == "__main__":
+    main_mod = _load_main()
+    if "--check" in sys.argv:
+        sys.exit(0 if check(main_mod) else 1)
+    benchmark(main_mod)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Benchmark dos relatórios diário/semanal (improved_reports) sobre uma pesquisa guardada
+
+O search_data é construído a partir de test_faro_7days_auto_groups.json (resposta
+CarJet gravada), replicada por todas as durações das definições e pelas 2 localizações.
+
+Uso:
+    python benchmark_reports.py            # tempos por relatório e em batch
+    python benchmark_reports.py --check    # confirma que o batch gera o mesmo HTML
+                                           # que as funções por localização
+"""
+
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE = os.path.join(BASE_DIR, "test_faro_7days_auto_groups.json")
+LOCATIONS = ["Albufeira", "Aeroporto de Faro"]
+DAYS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 14, 22, 28, 31]
+KINDS = ("daily", "weekly")
+LANGUAGES = ("pt", "en")
+
+
+def load_search_data() -> dict:
+    with open(FIXTURE, encoding="utf-8") as f:
+        recorded = json.load(f)
+    base_days = recorded.get("days") or 7
+    results = []
+    for location in LOCATIONS:
+        for days in DAYS:
+            for item in recorded["results"]:
+                price = float(re.sub(r"[^\d.]", "", item["price"]))
+                results.append(dict(item, location=location, days=days,
+                                    price_num=round(price * days / base_days, 2)))
+    return {"results": results}
+
+
+def _load_reports():
+    sys.path.insert(0, BASE_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import improved_reports
+    return improved_reports
+
+
+def _best(fn, rounds: int) -> float:
+    best = None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def check(reports, search_data) -> bool:
+    batch = reports.render_reports_batch(search_data, LOCATIONS, KINDS, LANGUAGES)
+    ok = True
+    for (kind, location, lang), html in batch.items():
+        single = getattr(reports, f"generate_{kind}_report_html_by_location")(search_data, location, lang)
+        status = "OK" if single == html else "DIFF"
+        ok = ok and status == "OK"
+        print(f"{status:4}  {kind:7} {lang}  {location:20} {len(html) // 1024:6} KB")
+    return ok
+
+
+def benchmark(reports, search_data, rounds: int = 5) -> None:
+    print(f"{len(search_data['results'])} resultados, {len(LOCATIONS)} localizações, {len(DAYS)} durações")
+    total = 0.0
+    for kind in KINDS:
+        fn = getattr(reports, f"generate_{kind}_report_html_by_location")
+        for location in LOCATIONS:
+            for lang in LANGUAGES:
+                dt = _best(lambda: fn(search_data, location, lang), rounds)
+                total += dt
+                print(f"{kind:7} {lang}  {location:20} {dt * 1000:8.1f} ms")
+    print(f"{'TOTAL (um a um)':32} {total * 1000:8.1f} ms")
+    dt = _best(lambda: reports.render_reports_batch(search_data, LOCATIONS, KINDS, LANGUAGES), rounds)
+    print(f"{'BATCH':32} {dt * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    reports_mod = _load_reports()
+    data = load_search_data()
+    if "--check" in sys.argv:
+        sys.exit(0 if check(reports_mod, data) else 1)
+    benchmark(reports_mod, data)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Build dos assets estáticos dos templates grandes
+
+Os <script>/<style> inline (sem Jinja) dos templates grandes passam para bundles
+em static/dist com hash do conteúdo no nome, comprimidos de antemão (.gz e .br)
+e servidos pela app com cache imutável. Os templates sem o JS/CSS ficam em
+templates/dist; a app só os usa enquanto o hash do template original coincidir
+com o do manifest (editar o original sem correr o build volta ao inline).
+
+    python build_static_assets.py                  # templates de TARGETS
+    python build_static_assets.py login.html ...   # outros templates
+
+Brotli é opcional (pip install Brotli); sem ele só são gerados os .gz.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATES_DIST = os.path.join(TEMPLATES_DIR, "dist")
+STATIC_DIST = os.path.join(BASE_DIR, "static", "dist")
+MANIFEST = os.path.join(STATIC_DIST, "manifest.json")
+URL_PREFIX = "/static/dist/"
+
+TARGETS = [
+    "price_automation.html",
+    "price_automation_settings.html",
+    "damage_report.html",
+    "index.html",
+]
+
+# Blocos pequenos ficam inline (um pedido extra custa mais do que os bytes)
+INLINE_MIN_BYTES = 2048
+HASH_LEN = 12
+
+BLOCK_RX = re.compile(r"<(script|style)\b([^>]*)>(.*?)</\1\s*>", re.S | re.I)
+JINJA_RX = re.compile(r"\{\{|\{%|\{#")
+SRC_RX = re.compile(r"\bsrc\s*=", re.I)
+TYPE_RX = re.compile(r"""\btype\s*=\s*["']?([^"'\s>]+)""", re.I)
+MEDIA_RX = re.compile(r"""\bmedia\s*=\s*("[^"]*"|'[^']*')""", re.I)
+JS_TYPES = {"text/javascript", "application/javascript", "module"}
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _extractable(tag: str, attrs: str, body: str) -> bool:
+    if len(body.encode("utf-8")) < INLINE_MIN_BYTES or JINJA_RX.search(body):
+        return False
+    if tag == "script":
+        if SRC_RX.search(attrs):
+            return False
+        m = TYPE_RX.search(attrs)
+        # application/json, text/template, ... não são código
+        if m and m.group(1).lower() not in JS_TYPES:
+            return False
+    return True
+
+
+def _write_asset(stem: str, ext: str, body: str) -> str:
+    data = body.strip("\n").encode("utf-8") + b"\n"
+    name = f"{stem}.{sha256(data)[:HASH_LEN]}.{ext}"
+    path = os.path.join(STATIC_DIST, name)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+        # mtime=0 -> o mesmo conteúdo gera sempre o mesmo .gz
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + ".br", "wb") as f:
+                f.write(brotli.compress(data, quality=11))
+    return URL_PREFIX + name
+
+
+def build_template(name: str) -> dict:
+    """Extrai os blocos de um template -> entrada do manifest"""
+    src_path = os.path.join(TEMPLATES_DIR, name)
+    with open(src_path, "rb") as f:
+        raw = f.read()
+    html = raw.decode("utf-8")
+    stem = os.path.splitext(os.path.basename(name))[0]
+    assets = []
+
+    def replace(m):
+        tag, attrs, body = m.group(1).lower(), m.group(2), m.group(3)
+        if not _extractable(tag, attrs, body):
+            return m.group(0)
+        if tag == "script":
+            url = _write_asset(stem, "js", body)
+            assets.append(url)
+            # mesma posição, sem defer/async -> a ordem de execução não muda
+            return f'<script{attrs} src="{url}"></script>'
+        url = _write_asset(stem, "css", body)
+        assets.append(url)
+        media = MEDIA_RX.search(attrs)
+        return f'<link rel="stylesheet" href="{url}"{" media=" + media.group(1) if media else ""}>'
+
+    built = BLOCK_RX.sub(replace, html)
+    os.makedirs(os.path.dirname(os.path.join(TEMPLATES_DIST, name)), exist_ok=True)
+    with open(os.path.join(TEMPLATES_DIST, name), "w", encoding="utf-8") as f:
+        f.write(built)
+    return {
+        "source_sha256": sha256(raw),
+        "built": f"dist/{name}",
+        "assets": assets,
+        "source_bytes": len(raw),
+        "built_bytes": len(built.encode("utf-8")),
+    }
+
+
+def _prune(keep: set) -> int:
+    """Remove bundles de builds anteriores que já nenhum template usa"""
+    removed = 0
+    for fname in os.listdir(STATIC_DIST):
+        if fname == os.path.basename(MANIFEST):
+            continue
+        base = fname[:-3] if fname.endswith((".gz", ".br")) else fname
+        if base not in keep:
+            os.remove(os.path.join(STATIC_DIST, fname))
+            removed += 1
+    return removed
+
+
+def main(names):
+    os.makedirs(STATIC_DIST, exist_ok=True)
+    os.makedirs(TEMPLATES_DIST, exist_ok=True)
+    started = time.perf_counter()
+    manifest = {"templates": {}}
+    if os.path.exists(MANIFEST):
+        # Build parcial (só alguns templates): os restantes continuam válidos
+        with open(MANIFEST, encoding="utf-8") as f:
+            manifest = json.load(f)
+    for name in names:
+        entry = build_template(name)
+        manifest["templates"][name] = entry
+        print(f"{name:35} {entry['source_bytes'] // 1024:6} KB -> {entry['built_bytes'] // 1024:5} KB"
+              f"  ({len(entry['assets'])} bundles)")
+    keep = {url[len(URL_PREFIX):] for entry in manifest["templates"].values() for url in entry["assets"]}
+    removed = _prune(keep)
+    with open(MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"✅ {len(keep)} bundles em static/dist"
+          f"{' (gz+br)' if brotli is not None else ' (só gz: Brotli não instalado)'}"
+          f", {removed} ficheiros antigos removidos ({time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or TARGETS)
@@ -1,13 +1,18 @@
 """
 CarJet Direct API - Parse completo com suppliers e categorias
 """
-import urllib.request
+import asyncio
+import concurrent.futures
+import http.cookiejar
+import os
 import urllib.parse
+import weakref
 from datetime import datetime
 import uuid
 import re
 import time
 from typing import List, Dict, Any, Optional
+import httpx
 from bs4 import BeautifulSoup
 
 
@@ -923,38 +928,139 @@ def detect_category_from_car(car_name: str, transmission: str = '') -> str:
     return 'ECONOMY'
 
 
-def scrape_carjet_direct(location: str, start_dt: datetime, end_dt: datetime, quick: int = 0) -> List[Dict[str, Any]]:
+# Configuração do scraping direto (async / httpx)
+CARJET_BASE_URL = os.getenv('CARJET_BASE_URL', 'https://www.carjet.com').rstrip('/')
+CARJET_MAX_CONCURRENCY = int(os.getenv('CARJET_MAX_CONCURRENCY', '4'))  # pedidos simultâneos por host
+CARJET_HTTP_TIMEOUT = 30.0
+
+# Polling da página "Waiting Prices": a primeira espera acompanha o tempo que as últimas
+# pesquisas demoraram a ficar prontas; depois cresce 1.5x até POLL_MAX_DELAY.
+# O orçamento total é o mesmo do polling antigo (3+4+5+6+7+8 = 33s).
+POLL_FIRST_DELAY = 3.0  # sem histórico para o host
+POLL_MIN_DELAY = 1.0
+POLL_MAX_DELAY = 8.0
+POLL_BACKOFF = 1.5
+POLL_BUDGET = 33.0
+
+LOCATION_CODES = {
+    'faro': 'FAO02',
+    'aeroporto de faro': 'FAO02',
+    'albufeira': 'ABF01',
+    'lisboa': 'LIS01',
+    'porto': 'OPO01',
+    'funchal': 'FNC01',
+    'ponta delgada': 'PDL01',
+}
+
+# Headers simulando iPhone 13 Pro Mobile Safari (IGUAL AO SELENIUM/PLAYWRIGHT!)
+DIRECT_HEADERS = {
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'pt-PT,pt;q=0.9',
+    'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1',
+    'Referer': 'https://www.carjet.com/aluguel-carros/index.htm',
+    'Origin': 'https://www.carjet.com',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1'
+    # NOTE: NÃO incluir cookies no POST inicial - CarJet rejeita o formulário com cookies
+    # Os cookies serão adicionados apenas no redirect GET para forçar EUR
+}
+EUR_COOKIES = 'monedaForzada=EUR; moneda=EUR; currency=EUR; country=PT; idioma=PT; lang=pt'
+
+
+class _LoopState:
+    """Cliente HTTP partilhado + semáforos por host (um por event loop)"""
+
+    def __init__(self):
+        # Sem cookie jar: o POST tem de ir sem cookies e o GET leva só os de EUR
+        self.client = httpx.AsyncClient(
+            timeout=CARJET_HTTP_TIMEOUT,
+            follow_redirects=True,
+            cookies=httpx.Cookies(),
+            limits=httpx.Limits(max_connections=CARJET_MAX_CONCURRENCY * 4,
+                                max_keepalive_connections=CARJET_MAX_CONCURRENCY * 2),
+        )
+        self.client.cookies.jar.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        self.host_slots: Dict[str, asyncio.Semaphore] = {}
+        self.ready_after: Dict[str, float] = {}  # média móvel do tempo até resultados
+
+    def slot(self, host: str) -> asyncio.Semaphore:
+        sem = self.host_slots.get(host)
+        if sem is None:
+            sem = self.host_slots[host] = asyncio.Semaphore(CARJET_MAX_CONCURRENCY)
+        return sem
+
+
+_loop_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+
+def _get_loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None:
+        state = _loop_states[loop] = _LoopState()
+    return state
+
+
+async def close_direct_client() -> None:
+    """Fecha o cliente partilhado do event loop atual (shutdown da app / testes)"""
+    state = _loop_states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.client.aclose()
+
+
+async def _fetch(state: _LoopState, method: str, url: str, **kwargs) -> str:
+    host = httpx.URL(url).host
+    async with state.slot(host):
+        response = await state.client.request(method, url, **kwargs)
+        response.raise_for_status()
+        return response.content.decode('utf-8')
+
+
+def _is_loading_page(html: str) -> bool:
+    return (
+        'A carregar...' in html or
+        'Procurando' in html or
+        'Searching' in html or
+        len(html) < 50000  # Página de loading é pequena (11KB)
+    )
+
+
+def _poll_delays(first: float):
+    """Esperas sucessivas até esgotar POLL_BUDGET"""
+    delay = min(max(first, POLL_MIN_DELAY), POLL_MAX_DELAY)
+    spent = 0.0
+    while spent + delay <= POLL_BUDGET + 1e-9:
+        yield delay
+        spent += delay
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+
+async def scrape_carjet_direct_async(location: str, start_dt: datetime, end_dt: datetime, quick: int = 0,
+                                     base_url: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Pesquisa CarJet sem bloquear o event loop
+
+    Usa um httpx.AsyncClient partilhado (keep-alive), limita pedidos simultâneos por
+    host a CARJET_MAX_CONCURRENCY e espera pelos resultados com asyncio.sleep, por isso
+    várias pesquisas podem estar em curso ao mesmo tempo.
+    """
     try:
         print(f"[DIRECT] Location: {location}, Start: {start_dt}, End: {end_dt}")
         
-        location_codes = {
-            'faro': 'FAO02',
-            'aeroporto de faro': 'FAO02',
-            'albufeira': 'ABF01',
-            'lisboa': 'LIS01',
-            'porto': 'OPO01',
-            'funchal': 'FNC01',
-            'ponta delgada': 'PDL01',
-        }
-        
         loc_lower = location.lower()
         pickup_code = 'FAO02'
-        for key, code in location_codes.items():
+        for key, code in LOCATION_CODES.items():
             if key in loc_lower:
                 pickup_code = code
                 break
         
         print(f"[DIRECT] Código: {pickup_code}")
         
-        pickup_date = to_carjet_format(start_dt)
-        return_date = to_carjet_format(end_dt)
-        session_id = str(uuid.uuid4())
-        
         form_data = {
             'frmDestino': pickup_code,
             'frmDestinoFinal': '',
-            'frmFechaRecogida': pickup_date,
-            'frmFechaDevolucion': return_date,
+            'frmFechaRecogida': to_carjet_format(start_dt),
+            'frmFechaDevolucion': to_carjet_format(end_dt),
             'frmHasAge': 'False',
             'frmEdad': '35',
             'frmPrvNo': '',
@@ -963,32 +1069,18 @@ def scrape_carjet_direct(location: str, start_dt: datetime, end_dt: datetime, qu
             'frmJsonFilterInfo': '',
             'frmTipoVeh': 'CAR',
             'idioma': 'PT',
-            'frmSession': session_id,
+            'frmSession': str(uuid.uuid4()),
             'frmDetailCode': ''
         }
         
-        encoded_data = urllib.parse.urlencode(form_data).encode('utf-8')
-        url = 'https://www.carjet.com/do/list/pt'
-        
-        # Headers simulando iPhone 13 Pro Mobile Safari (IGUAL AO SELENIUM/PLAYWRIGHT!)
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'pt-PT,pt;q=0.9',
-            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1',
-            'Referer': 'https://www.carjet.com/aluguel-carros/index.htm',
-            'Origin': 'https://www.carjet.com',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1'
-            # NOTE: NÃO incluir cookies no POST inicial - CarJet rejeita o formulário com cookies
-            # Os cookies serão adicionados apenas no redirect GET para forçar EUR
-        }
+        base = (base_url or CARJET_BASE_URL).rstrip('/')
+        url = f'{base}/do/list/pt'
+        state = _get_loop_state()
         
         print(f"[DIRECT] POST → {url}")
-        req = urllib.request.Request(url, data=encoded_data, headers=headers, method='POST')
-        
-        with urllib.request.urlopen(req, timeout=30) as response:
-            html = response.read().decode('utf-8')
+        html = await _fetch(state, 'POST', url, content=urllib.parse.urlencode(form_data).encode('utf-8'),
+                            headers=DIRECT_HEADERS)
+        posted_at = time.monotonic()
         
         print(f"[DIRECT] HTML: {len(html)} bytes")
         
@@ -1001,50 +1093,44 @@ def scrape_carjet_direct(location: str, start_dt: datetime, end_dt: datetime, qu
         if 'Waiting Prices' in html or 'window.location.replace' in html:
             redirect_url = extract_redirect_url(html)
             if redirect_url:
-                full_url = f'https://www.carjet.com{redirect_url}'
+                full_url = f'{base}{redirect_url}'
                 print(f"[DIRECT] Redirect → {full_url[:80]}...")
                 
                 # Headers para o redirect GET - com cookies para forçar EUR
-                headers_with_cookies = dict(headers)
-                headers_with_cookies['Cookie'] = 'monedaForzada=EUR; moneda=EUR; currency=EUR; country=PT; idioma=PT; lang=pt'
+                headers_with_cookies = dict(DIRECT_HEADERS)
+                headers_with_cookies['Cookie'] = EUR_COOKIES
                 
-                # POLLING: Tentar múltiplas vezes até carros aparecerem
-                max_attempts = 6
-                delays = [3, 4, 5, 6, 7, 8]  # Delays progressivos (total: 33s)
-                
-                for attempt in range(max_attempts):
-                    delay = delays[attempt] if attempt < len(delays) else 8
-                    print(f"[DIRECT] Tentativa {attempt + 1}/{max_attempts} - aguardando {delay}s...")
-                    time.sleep(delay)
-                    
-                    req2 = urllib.request.Request(full_url, headers=headers_with_cookies, method='GET')
-                    
-                    with urllib.request.urlopen(req2, timeout=30) as response2:
-                        html = response2.read().decode('utf-8')
+                host = httpx.URL(full_url).host
+                first_delay = 0.8 * state.ready_after[host] if host in state.ready_after else POLL_FIRST_DELAY
+                ready = False
+                attempt = 0
+                for delay in _poll_delays(first_delay):
+                    attempt += 1
+                    print(f"[DIRECT] Tentativa {attempt} - aguardando {delay:.1f}s...")
+                    await asyncio.sleep(delay)
                     
+                    html = await _fetch(state, 'GET', full_url, headers=headers_with_cookies)
                     print(f"[DIRECT] HTML recebido: {len(html)} bytes")
                     
                     # Verificar se ainda é página de loading
-                    is_loading_page = (
-                        'A carregar...' in html or
-                        'Procurando' in html or
-                        'Searching' in html or
-                        len(html) < 50000  # Página de loading é pequena (11KB)
-                    )
+                    if _is_loading_page(html):
+                        print(f"[DIRECT] ⏳ Ainda a carregar... (tentativa {attempt})")
+                        continue
                     
-                    if is_loading_page:
-                        print(f"[DIRECT] ⏳ Ainda a carregar... (tentativa {attempt + 1}/{max_attempts})")
-                        if attempt < max_attempts - 1:
-                            continue  # Tentar novamente
-                        else:
-                            print(f"[DIRECT] ⚠️ Timeout após {max_attempts} tentativas")
-                            return []  # Desistir
-                    else:
-                        # HTML grande = resultados prontos!
-                        print(f"[DIRECT] ✅ Resultados prontos! (tentativa {attempt + 1})")
-                        break  # Sair do loop
+                    # HTML grande = resultados prontos!
+                    print(f"[DIRECT] ✅ Resultados prontos! (tentativa {attempt})")
+                    elapsed = time.monotonic() - posted_at
+                    prev = state.ready_after.get(host)
+                    state.ready_after[host] = elapsed if prev is None else 0.7 * prev + 0.3 * elapsed
+                    ready = True
+                    break
+                
+                if not ready:
+                    print(f"[DIRECT] ⚠️ Timeout após {attempt} tentativas")
+                    return []  # Desistir
         
-        items = parse_carjet_html_complete(html)
+        # Parse (BeautifulSoup) fora do event loop
+        items = await asyncio.to_thread(parse_carjet_html_complete, html)
         print(f"[DIRECT API] ✅ {len(items)} carros extraídos")
         return items
         
@@ -1055,6 +1141,26 @@ def scrape_carjet_direct(location: str, start_dt: datetime, end_dt: datetime, qu
         return []
 
 
+def scrape_carjet_direct(location: str, start_dt: datetime, end_dt: datetime, quick: int = 0) -> List[Dict[str, Any]]:
+    """Versão síncrona (scripts/CLI) de scrape_carjet_direct_async
+
+    Dentro de código async usar diretamente ``await scrape_carjet_direct_async(...)``.
+    """
+    async def _run():
+        try:
+            return await scrape_carjet_direct_async(location, start_dt, end_dt, quick)
+        finally:
+            await close_direct_client()
+    
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_run())
+    # Chamado de dentro de um event loop: correr num thread próprio
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, _run()).result()
+
+
 def parse_carjet_html_complete(html: str) -> List[Dict[str, Any]]:
     """Parse completo com BeautifulSoup - extrai supplier, category, photos"""
     items = []
@@ -0,0 +1,765 @@
+"""
+Motor de PDFs dos Damage Reports: template ativo + coordenadas mapeadas -> PDF preenchido
+
+O template (PDF de ~2 MB, com um content stream enorme por página) é lido uma vez
+por TemplatePlan e as coordenadas ficam compiladas por página (tipo de campo,
+estilo, alias e Y já convertidos). Em cada render as páginas do template são
+copiadas tal como estão e o overlay do ReportLab entra por cima como Form XObject;
+o content stream do template nunca é interpretado nem reescrito (era o que o
+merge_page do PyPDF2 fazia, segundos por PDF).
+
+As imagens (croqui, fotos, assinaturas) processadas ficam num LRU pelo hash do
+base64, por isso o mesmo croqui/foto em vários PDFs é descodificado uma vez.
+
+Sem dependências da app: render_batch corre nos processos do pool de main.py.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageChops
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, NameObject,
+)
+from reportlab import rl_config
+from reportlab.lib.colors import black, grey
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas as rl_canvas
+
+logger = logging.getLogger(__name__)
+
+# Streams binários em vez de ASCII85: sem o rl_accel (C) o encoder do ReportLab é
+# Python puro e era ~1/3 do tempo de cada PDF (e o resultado fica mais pequeno)
+rl_config.useA85 = 0
+
+# Imagens já processadas (bytes prontos para o ReportLab) por hash do valor
+IMAGE_CACHE_MAX_BYTES = 48 * 1024 * 1024
+# Plans em memória nos workers do pool (normalmente só o template ativo)
+MAX_WORKER_PLANS = 2
+
+# FIELD NAME ALIASES: Mapear snake_case (BD) → camelCase (report_data)
+# Necessário porque coordenadas usam snake_case mas report_data tem camelCase
+FIELD_ALIASES = {
+    'ra_number': 'ra_number',
+    'contract_number': 'contractNumber',
+    'dr_number': 'dr_number',
+    'vehicle_diagram': 'vehicle_diagram',
+    'vehicleDiagram': 'vehicle_diagram',
+    'damage_pins': 'damage_pins',
+    'customer_name': 'clientName',
+    'customer_email': 'clientEmail',
+    'customer_phone': 'clientPhone',
+    'customer_address': 'address',
+    'customer_postal': 'customer_postal',  # Código Postal + Cidade (campo combinado)
+    'postalCodeCity': 'customer_postal',
+    'customer_city': 'city',
+    'customer_country': 'country',
+    'vehicle_plate': 'vehiclePlate',
+    'vehicle_brand': 'vehicleBrand',
+    'vehicle_model': 'vehicleModel',
+    'vehicle_brand_model': 'vehicleBrandModel',  # Campo combinado Marca / Modelo
+    'vehicleBrandModel': 'vehicleBrandModel',
+    'vehicle_color': 'vehicleColor',
+    'vehicle_km': 'vehicleKm',
+    'pickup_date': 'pickupDate',
+    'pickup_time': 'pickupTime',
+    'pickup_location': 'pickupLocation',
+    'return_date': 'returnDate',
+    'return_time': 'returnTime',
+    'return_location': 'returnLocation',
+    'total_amount': 'total_amount',
+    'total_repair_cost': 'total_amount',
+    'totalRepairCost': 'total_amount',
+    'inspector_name': 'inspector_name',
+    'issued_by': 'issued_by',
+    'inspection_date': 'inspection_date',
+}
+# damage_description_line_X (mapeador) → damage_X (report_data)
+for _i in range(1, 16):
+    FIELD_ALIASES[f'damage_description_line_{_i}'] = f'damage_{_i}'
+
+
+# ============================================================
+# Tipos, estilos e formatação dos campos
+# ============================================================
+
+def detect_field_type(field_id: str) -> str:
+    """
+    Detecta o tipo de campo baseado no field_id
+    Retorna: 'text', 'image', 'signature', 'table', 'images', 'currency', 'date', 'number', 'hours'
+    """
+    field_id_lower = field_id.lower()
+
+    if 'signature' in field_id_lower or 'sign' in field_id_lower:
+        return 'signature'
+    elif 'photo' in field_id_lower or 'image' in field_id_lower or 'croqui' in field_id_lower or 'diagram' in field_id_lower:
+        return 'image'
+    elif field_id_lower == 'repair_items' or field_id_lower == 'table_repair':
+        # Apenas repair_items (JSON array) é tabela - repair_line_X são campos individuais
+        return 'table'
+    elif 'images' in field_id_lower:
+        return 'images'
+    elif 'hours' in field_id_lower or 'hour' in field_id_lower:
+        return 'hours'  # ✅ TIPO SEPARADO para horas (sem decimais)
+    elif any(word in field_id_lower for word in ['cost', 'price', 'total', 'subtotal']):
+        return 'currency'
+    elif 'date' in field_id_lower:
+        return 'date'
+    elif any(word in field_id_lower for word in ['km', 'quantity', 'qty', 'number']) and not any(exclude in field_id_lower for exclude in ['contract', 'dr_number', 'ra_number', 'phone']):
+        return 'number'
+    else:
+        return 'text'
+
+
+def get_field_style(field_id: str) -> dict:
+    """
+    Retorna estilo customizado para o campo
+    Retorna: {'font': str, 'size': int, 'color': tuple, 'bold': bool, 'italic': bool}
+    """
+    field_id_lower = field_id.lower()
+
+    # Default style - Arial 8pt, sem negrito ou itálico
+    style = {
+        'font': 'Helvetica',  # ReportLab usa Helvetica (similar a Arial)
+        'size': 8,
+        'color': (0, 0, 0),  # RGB black
+        'bold': False,
+        'italic': False
+    }
+
+    # EXCEÇÕES:
+    # DR number e RA number (contract) ficam em negrito
+    if any(word in field_id_lower for word in ['dr_number', 'contract_number', 'contractnumber']):
+        style['bold'] = True
+
+    # Total da reparação: 9pt bold
+    if any(word in field_id_lower for word in ['total_repair', 'totalrepair', 'total_cost', 'totalcost']):
+        style['size'] = 9
+        style['bold'] = True
+
+    return style
+
+
+def calculate_centered_y(y, height, font_size):
+    """
+    Calcula a posição Y para centralizar verticalmente o texto na caixa
+    y: posição Y da caixa (inferior)
+    height: altura da caixa
+    font_size: tamanho da fonte
+    """
+    # ReportLab desenha texto a partir da baseline
+    # Para centralizar: y + (height / 2) - (font_size / 3)
+    return y + (height / 2) - (font_size / 3)
+
+
+def format_currency(value) -> str:
+    """Formata valor como moeda portuguesa (120,00) - SEM € pois já está no template"""
+    try:
+        # Convert to float
+        if isinstance(value, str):
+            value = float(value.replace(',', '.').replace('€', '').strip())
+
+        # Format with thousands separator and 2 decimals - SEM símbolo €
+        return f"{value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+    except:
+        return str(value)
+
+
+def format_date(value) -> str:
+    """Formata data como dd/mm/yyyy"""
+    try:
+        if not value:
+            return ''
+
+        # Try to parse various formats
+        for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d']:
+            try:
+                dt = datetime.strptime(str(value), fmt)
+                return dt.strftime('%d/%m/%Y')
+            except:
+                continue
+
+        return str(value)
+    except:
+        return str(value)
+
+
+def format_number(value) -> str:
+    """Formata número com separadores de milhar"""
+    try:
+        if isinstance(value, str):
+            value = float(value.replace(',', '.').strip())
+
+        # Format with thousands separator
+        return f"{value:,.0f}".replace(',', '.')
+    except:
+        return str(value)
+
+
+def format_hours(value) -> str:
+    """Formata horas SEM casas decimais"""
+    try:
+        if isinstance(value, str):
+            value = float(value.replace(',', '.').strip())
+
+        # Sem casas decimais para horas
+        return f"{int(value)}"
+    except:
+        return str(value)
+
+
+def _decode_image(image_data) -> Image.Image:
+    """data URL / base64 -> imagem PIL (exceção se inválida ou < 10x10)"""
+    if not image_data:
+        raise ValueError("empty data")
+    if not isinstance(image_data, str):
+        raise ValueError(f"not a string, type={type(image_data)}")
+    img_data = image_data.split(',')[1] if ',' in image_data else image_data
+    if len(img_data) < 100:
+        raise ValueError(f"too short ({len(img_data)} chars)")
+    img = Image.open(BytesIO(base64.b64decode(img_data)))
+    if img.width < 10 or img.height < 10:
+        raise ValueError(f"too small ({img.width}x{img.height})")
+    return img
+
+
+def validate_image_data(image_data: str, field_id: str = "unknown") -> bool:
+    """Valida se dados de imagem são válidos"""
+    try:
+        img = _decode_image(image_data)
+        logger.debug(f"✅ [{field_id}] Image valid: {img.width}x{img.height}, {img.format}")
+        return True
+    except Exception as e:
+        logger.warning(f"❌ [{field_id}] Image validation failed: {e}")
+        return False
+
+
+def validate_table_data(table_data) -> bool:
+    """Valida estrutura da tabela de reparações"""
+    try:
+        if not table_data:
+            return False
+
+        if isinstance(table_data, str):
+            table_data = json.loads(table_data)
+
+        if not isinstance(table_data, list):
+            return False
+
+        # Check each row has required fields
+        for row in table_data:
+            if not isinstance(row, dict):
+                return False
+            # Must have at least 'description'
+            if 'description' not in row:
+                return False
+
+        return True
+    except:
+        return False
+
+
+# ============================================================
+# Imagens processadas (LRU por hash do valor)
+# ============================================================
+
+class _ImageCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return item
+
+    def put(self, key, item, size: int):
+        with self._lock:
+            if key in self._items or size > self.max_bytes:
+                return
+            self._items[key] = (item, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "images": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+_IMAGES = _ImageCache(IMAGE_CACHE_MAX_BYTES)
+_INVALID = object()
+
+
+def _remove_white_background(img: Image.Image) -> Image.Image:
+    """Croqui: pixels brancos/claros (RGB > 240) ficam transparentes, o resto mantém-se"""
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    r, g, b, a = img.split()
+    light = ImageChops.multiply(
+        ImageChops.multiply(r.point(lambda v: 255 if v > 240 else 0),
+                            g.point(lambda v: 255 if v > 240 else 0)),
+        b.point(lambda v: 255 if v > 240 else 0),
+    )
+    img.putalpha(ImageChops.multiply(a, ImageChops.invert(light)))
+    return img
+
+
+def _prepared_image(value: str, is_diagram: bool, width: float, height: float):
+    """
+    (bytes, (largura, altura) da imagem) prontos a desenhar, ou _INVALID
+
+    Croqui: PNG com o fundo branco transparente (CONTAIN na caixa).
+    Fotos/assinaturas: JPEG recortado ao tamanho da caixa (COVER).
+    """
+    digest = hashlib.sha1(value.encode('utf-8', 'surrogatepass')).hexdigest()
+    key = (digest, 'diagram') if is_diagram else (digest, 'cover', int(width), int(height))
+    cached = _IMAGES.get(key)
+    if cached is not None:
+        return cached[0]
+
+    try:
+        img = _decode_image(value)
+        img.load()
+    except Exception as e:
+        logger.warning(f"Invalid image data ({e}), drawing placeholder")
+        _IMAGES.put(key, _INVALID, 64)
+        return _INVALID
+
+    img_buffer = BytesIO()
+    if is_diagram:
+        img = _remove_white_background(img)
+        img.save(img_buffer, format='PNG')
+        prepared = (img_buffer.getvalue(), img.size)
+    else:
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Fotos normais: converter para RGB com fundo branco
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+            img = background
+
+        # COVER mode (preencher com crop)
+        img_width, img_height = img.size
+        img_aspect = img_width / img_height
+        box_aspect = width / height
+        if img_aspect > box_aspect:
+            # Imagem mais larga: ajustar pela ALTURA
+            new_height = height
+            new_width = height * img_aspect
+        else:
+            # Imagem mais alta: ajustar pela LARGURA
+            new_width = width
+            new_height = width / img_aspect
+
+        img_resized = img.resize((int(new_width), int(new_height)), Image.Resampling.LANCZOS)
+
+        # Crop para caixa exata (center crop)
+        if new_width > width:
+            left = (new_width - width) / 2
+            img_cropped = img_resized.crop((int(left), 0, int(left + width), int(new_height)))
+        else:
+            top = (new_height - height) / 2
+            img_cropped = img_resized.crop((0, int(top), int(new_width), int(top + height)))
+
+        if img_cropped.mode != 'RGB':
+            img_cropped = img_cropped.convert('RGB')
+        # JPEG -> o ReportLab embebe-o tal como está (sem recomprimir)
+        img_cropped.save(img_buffer, format='JPEG', quality=90)
+        prepared = (img_buffer.getvalue(), img.size)
+
+    _IMAGES.put(key, prepared, len(prepared[0]))
+    return prepared
+
+
+# ============================================================
+# Template compilado
+# ============================================================
+
+class PlanField:
+    __slots__ = ('field_id', 'alias', 'field_type', 'x', 'y', 'width', 'height', 'style', 'font_name')
+
+    def __init__(self, field_id: str, x: float, y: float, width: float, height: float):
+        self.field_id = field_id
+        self.alias = FIELD_ALIASES.get(field_id)
+        self.field_type = detect_field_type(field_id)
+        self.x, self.y, self.width, self.height = x, y, width, height
+        self.style = get_field_style(field_id)
+        font_name = f"{self.style['font']}-Bold" if self.style['bold'] else self.style['font']
+        self.font_name = f"{font_name}-Oblique" if self.style['italic'] and not self.style['bold'] else font_name
+
+    def value(self, report_data: dict):
+        # Valor do campo (field_id direto primeiro, depois alias)
+        value = report_data.get(self.field_id, '')
+        if not value and self.alias:
+            value = report_data.get(self.alias, '')
+        return value
+
+
+class TemplatePlan:
+    """
+    Template lido + campos compilados por página
+
+    coordinates: linhas (field_id, x, y, width, height, page) da tabela
+    damage_report_coordinates. O mesmo field_id pode estar em várias páginas;
+    repetido na mesma página, vale a última linha (como antes).
+    """
+
+    def __init__(self, template_data: bytes, coordinates: Sequence[Sequence]):
+        self.template_data = template_data
+        self.coordinates = [tuple(row) for row in coordinates]
+        self.key = plan_key(template_data, self.coordinates)
+        self.reader = PdfReader(BytesIO(template_data))
+        # O reader lê o BytesIO de forma preguiçosa: cópias das páginas uma de cada vez
+        self.lock = threading.Lock()
+
+        by_key: "OrderedDict[str, tuple]" = OrderedDict()
+        for field_id, x, y, width, height, page in coordinates:
+            page_num = int(page) if page else 1
+            by_key[f"{field_id}@page{page_num}"] = (field_id, float(x), float(y), float(width), float(height), page_num)
+
+        self.pages: List[Tuple[float, float, List[PlanField]]] = []
+        for index, page in enumerate(self.reader.pages):
+            page_width = float(page.mediabox.width)
+            page_height = float(page.mediabox.height)
+            fields = [
+                # Y do mapeador (topo, para baixo) -> Y do PDF (fundo, para cima)
+                PlanField(field_id, x, page_height - y - height, width, height)
+                for field_id, x, y, width, height, page_num in by_key.values()
+                if page_num == index + 1
+            ]
+            self.pages.append((page_width, page_height, fields))
+        self.field_count = len(by_key)
+
+
+def plan_key(template_data: bytes, coordinates: Sequence[Sequence]) -> str:
+    h = hashlib.sha256(template_data)
+    h.update(repr([tuple(row) for row in coordinates]).encode('utf-8'))
+    return h.hexdigest()[:24]
+
+
+# ============================================================
+# Render
+# ============================================================
+
+def _draw_placeholder(can, x, y, width, height, label):
+    can.setStrokeColor(grey)
+    can.setFillColor(grey)
+    can.rect(x, y, width, height, stroke=1, fill=0)
+    can.setFont("Helvetica", 6)
+    can.drawString(x + 2, y + height/2, label)
+
+
+def _draw_image(can, field: PlanField, value):
+    x, y, width, height = field.x, field.y, field.width, field.height
+    # Só data URLs / JPEG em base64 são desenhados
+    if not (isinstance(value, str) and ('data:image' in value or value.startswith('/9j'))):
+        if not validate_image_data(value, field.field_id):
+            _draw_placeholder(can, x, y, width, height, "[Invalid Image]")
+        return
+
+    is_diagram = 'diagram' in field.field_id.lower() or 'croqui' in field.field_id.lower()
+    try:
+        prepared = _prepared_image(value, is_diagram, width, height)
+        if prepared is _INVALID:
+            _draw_placeholder(can, x, y, width, height, "[Invalid Image]")
+            return
+        data, (img_width, img_height) = prepared
+
+        if is_diagram:
+            # DIAGRAMA: CONTAIN na box mapeada (os pins já vêm desenhados na imagem)
+            img_ratio = img_width / img_height
+            box_ratio = width / height
+            if img_ratio > box_ratio:
+                # Imagem mais larga - limitar por largura
+                draw_width = width
+                draw_height = width / img_ratio
+                draw_x = x
+                draw_y = y + (height - draw_height) / 2  # Centralizar verticalmente
+            else:
+                # Imagem mais alta - limitar por altura
+                draw_height = height
+                draw_width = height * img_ratio
+                draw_x = x + (width - draw_width) / 2  # Centralizar horizontalmente
+                draw_y = y
+            can.drawImage(
+                ImageReader(BytesIO(data)),
+                draw_x, draw_y,
+                width=draw_width,
+                height=draw_height,
+                preserveAspectRatio=True,
+                mask='auto'
+            )
+        else:
+            # FOTOS: COVER (já recortada ao tamanho da caixa)
+            can.drawImage(ImageReader(BytesIO(data)), x, y, width=width, height=height)
+    except Exception as e:
+        logger.error(f"Error drawing image {field.field_id}: {e}")
+        _draw_placeholder(can, x, y, width, height, "[Image]")
+
+
+def _draw_table(can, field: PlanField, value):
+    x, y, width, height = field.x, field.y, field.width, field.height
+    if not validate_table_data(value):
+        logger.warning(f"Invalid table data for {field.field_id}, drawing placeholder")
+        can.setFont("Helvetica", 7)
+        can.setFillColor(black)
+        can.drawString(x + 2, y + 4, "[Invalid Table Data]")
+        return
+
+    try:
+        # Parse table data (JSON array)
+        if isinstance(value, str):
+            table_data = json.loads(value) if value.startswith('[') else []
+        else:
+            table_data = value if isinstance(value, list) else []
+        if not table_data:
+            return
+
+        # Draw table grid
+        can.setStrokeColor(black)
+        can.setLineWidth(0.5)
+
+        num_rows = min(len(table_data), 10)  # Max 10 rows
+        row_height = height / (num_rows + 1)  # +1 for header
+
+        for i in range(num_rows + 2):
+            line_y = y + (i * row_height)
+            can.line(x, line_y, x + width, line_y)
+
+        # Vertical lines (5 columns: desc, qty, hours, price, total)
+        col_widths = [width * 0.35, width * 0.12, width * 0.13, width * 0.20, width * 0.20]
+        col_x = x
+        for col_width in col_widths:
+            can.line(col_x, y, col_x, y + height)
+            col_x += col_width
+        can.line(col_x, y, col_x, y + height)  # Last line
+
+        # Header (centrado verticalmente)
+        can.setFont("Helvetica-Bold", 7)
+        header_y = calculate_centered_y(y + height - row_height, row_height, 7)
+        can.drawString(x + 2, header_y, "Descrição")
+        can.drawString(x + col_widths[0] + 2, header_y, "Qtd")
+        can.drawString(x + col_widths[0] + col_widths[1] + 2, header_y, "Horas")
+        can.drawString(x + col_widths[0] + col_widths[1] + col_widths[2] + 2, header_y, "Preço")
+        can.drawString(x + col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3] + 2, header_y, "Total")
+
+        can.setFont("Helvetica", 6)
+        for i, row in enumerate(table_data[:10]):
+            row_y = calculate_centered_y(y + height - ((i + 2) * row_height), row_height, 6)
+
+            # Description (truncated, left-aligned)
+            can.drawString(x + 2, row_y, str(row.get('description', ''))[:30])
+
+            # Quantity (center-aligned)
+            qty_value = row.get('quantity', row.get('qty', ''))
+            can.drawCentredString(x + col_widths[0] + (col_widths[1] / 2), row_y,
+                                  format_number(qty_value) if qty_value else '')
+
+            # Hours (sem decimais, center-aligned)
+            hours_value = row.get('hours', '')
+            can.drawCentredString(x + col_widths[0] + col_widths[1] + (col_widths[2] / 2), row_y,
+                                  format_hours(hours_value) if hours_value else '')
+
+            # Price / Total (right-aligned, € no template)
+            price_x = x + col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3] - 5
+            can.drawRightString(price_x, row_y, format_currency(row.get('price', '')) if row.get('price') else '')
+            total_x = price_x + col_widths[4]
+            can.drawRightString(total_x, row_y, format_currency(row.get('total', '')) if row.get('total') else '')
+    except Exception as e:
+        logger.error(f"Error drawing table {field.field_id}: {e}")
+        # Fallback: draw text
+        can.setFont("Helvetica", 8)
+        can.setFillColor(black)
+        can.drawString(x + 2, calculate_centered_y(y, height, 8), str(value)[:50])
+
+
+def _draw_text(can, field: PlanField, value):
+    x, y, width, height = field.x, field.y, field.width, field.height
+    style = field.style
+    can.setFont(field.font_name, style['size'])
+    can.setFillColorRGB(*style['color'])
+    text_y = calculate_centered_y(y, height, style['size'])
+    field_type = field.field_type
+
+    if field_type == 'currency':
+        # Right-align para alinhar com símbolo € no template
+        can.drawRightString(x + width - 5, text_y, format_currency(value))
+    elif field_type == 'date':
+        can.drawString(x + 2, text_y, format_date(value))
+    elif field_type == 'number':
+        # QUANTIDADES: CENTER-ALIGNED (repair_line_X_qty)
+        if '_qty' in field.field_id.lower():
+            can.drawCentredString(x + width / 2, text_y, format_number(value))
+        else:
+            can.drawString(x + 2, text_y, format_number(value))
+    elif field_type == 'hours':
+        can.drawCentredString(x + width / 2, text_y, format_hours(value))
+    else:
+        field_id = field.field_id
+        # Convert to uppercase (except for notes/observations fields)
+        text_value = str(value)
+        if 'notes' not in field_id and 'observation' not in field_id:
+            text_value = text_value.upper()
+
+        field_id_lower = field_id.lower()
+        if 'dr_number' in field_id_lower or 'ra_number' in field_id_lower or 'contract' in field_id_lower:
+            # DR NUMBER, RA NUMBER, CONTRACT NUMBER: RIGHT-ALIGNED
+            can.drawRightString(x + width - 2, text_y, text_value[:50])
+        elif 'description' in field_id or 'notes' in field_id or 'damage' in field_id:
+            # Multiline text - cada linha centrada verticalmente
+            lines = text_value.split('\n')
+            if len(lines) == 1:
+                can.drawString(x + 2, text_y, lines[0][:int(width / 5)])
+            else:
+                line_height = style['size'] + 2
+                lines_to_draw = lines[:int(height / line_height)]
+                total_text_height = len(lines_to_draw) * line_height
+                start_y = y + (height - total_text_height) / 2 + total_text_height - line_height
+                for i, line in enumerate(lines_to_draw):
+                    if start_y - (i * line_height) > y:
+                        line_y = start_y - (i * line_height) + (line_height - style['size']) / 2
+                        can.drawString(x + 2, line_y, line[:int(width / 5)])
+        else:
+            can.drawString(x + 2, text_y, text_value[:int(width / 5)])
+
+
+def _overlay(page_width: float, page_height: float, fields: List[PlanField], report_data: dict) -> Optional[bytes]:
+    """PDF de uma página só com os campos preenchidos (None se não houver nada a desenhar)"""
+    packet = BytesIO()
+    can = rl_canvas.Canvas(packet, pagesize=(page_width, page_height))
+    can.setFont("Helvetica", 8)
+    drawn = 0
+    for field in fields:
+        value = field.value(report_data)
+        if not value:
+            continue
+        drawn += 1
+        if field.field_type in ('image', 'signature'):
+            _draw_image(can, field, value)
+        elif field.field_type == 'table':
+            _draw_table(can, field, value)
+        else:
+            _draw_text(can, field, value)
+    if not drawn:
+        return None
+    can.save()
+    return packet.getvalue()
+
+
+def _stamp(writer: PdfWriter, page, overlay: bytes, name: str):
+    """
+    Overlay por cima da página como Form XObject: o conteúdo original fica entre
+    q/Q e só se acrescentam referências (o mesmo efeito do merge_page, sem
+    interpretar o content stream do template)
+    """
+    overlay_page = PdfReader(BytesIO(overlay)).pages[0]
+    source = overlay_page["/Contents"].get_object()
+
+    form = EncodedStreamObject()
+    form._data = source._data
+    for key in ("/Filter", "/DecodeParms"):
+        if key in source:
+            form[NameObject(key)] = source[key].clone(writer)
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = overlay_page.mediabox.clone(writer)
+    form[NameObject("/Resources")] = overlay_page["/Resources"].get_object().clone(writer)
+    form_ref = writer._add_object(form)
+
+    resources = page.get("/Resources")
+    if resources is None:
+        resources = DictionaryObject()
+        page[NameObject("/Resources")] = resources
+    resources = resources.get_object()
+    xobjects = resources.get("/XObject")
+    if xobjects is None:
+        xobjects = DictionaryObject()
+        resources[NameObject("/XObject")] = xobjects
+    xobjects = xobjects.get_object()
+    while name in xobjects:
+        name += "_"
+    xobjects[NameObject(name)] = form_ref
+
+    before = DecodedStreamObject()
+    before.set_data(b"q\n")
+    after = DecodedStreamObject()
+    after.set_data(f"\nQ\nq {name} Do Q\n".encode("ascii"))
+
+    original = page.raw_get("/Contents") if "/Contents" in page else None
+    contents = ArrayObject([writer._add_object(before)])
+    if isinstance(original, ArrayObject):
+        contents.extend(original)
+    elif original is not None:
+        contents.append(original)
+    contents.append(writer._add_object(after))
+    page[NameObject("/Contents")] = contents
+
+
+def render(plan: TemplatePlan, report_data: dict) -> bytes:
+    """PDF preenchido (bytes) para um report_data"""
+    writer = PdfWriter()
+    with plan.lock:
+        pages = [writer.add_page(page) for page in plan.reader.pages]
+    for index, (page, (page_width, page_height, fields)) in enumerate(zip(pages, plan.pages)):
+        overlay = _overlay(page_width, page_height, fields, report_data)
+        if overlay is not None:
+            _stamp(writer, page, overlay, f"/DROverlay{index + 1}")
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+# ============================================================
+# Batch (processos do pool)
+# ============================================================
+
+_WORKER_PLANS: "OrderedDict[str, TemplatePlan]" = OrderedDict()
+
+
+def _worker_plan(key: str, template_data: bytes, coordinates) -> TemplatePlan:
+    plan = _WORKER_PLANS.get(key)
+    if plan is None:
+        plan = TemplatePlan(template_data, coordinates)
+        _WORKER_PLANS[key] = plan
+        while len(_WORKER_PLANS) > MAX_WORKER_PLANS:
+            _WORKER_PLANS.popitem(last=False)
+    return plan
+
+
+def render_batch(key: str, template_data: bytes, coordinates, reports: List[dict]) -> List[Dict[str, Any]]:
+    """
+    Corre num worker: vários PDFs com o mesmo template
+    Devolve por report {"ok": True, "pdf": bytes} ou {"ok": False, "error": str}
+    """
+    plan = _worker_plan(key, template_data, coordinates)
+    results = []
+    for report_data in reports:
+        try:
+            results.append({"ok": True, "pdf": render(plan, report_data)})
+        except Exception as e:
+            logger.error(f"Error rendering damage report PDF: {e}")
+            results.append({"ok": False, "error": str(e)})
+    return results
+
+
+def image_cache_stats() -> dict:
+    return _IMAGES.snapshot()
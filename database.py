@@ -4,9 +4,15 @@ Supports both SQLite (local development) and PostgreSQL (production)
 """
 
 import os
+import re
 import sqlite3
+import time
+import asyncio
+import threading
+from functools import lru_cache
 from typing import Optional
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 # Check if we're in production (Render) or local development
@@ -28,6 +34,9 @@ if not DATABASE_URL:
         logging.warning(f"Could not extract DATABASE_URL: {e}")
 
 USE_POSTGRES = DATABASE_URL is not None
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20") or 20)
+DB_POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "30") or 30)
+DB_POOL_LOOP_WAIT_TIMEOUT = float(os.getenv("DB_POOL_LOOP_WAIT_TIMEOUT", "0") or 0)
 
 if USE_POSTGRES:
     import psycopg2
@@ -50,7 +59,7 @@ if USE_POSTGRES:
     try:
         connection_pool = pool.ThreadedConnectionPool(
             minconn=5,
-            maxconn=20,
+            maxconn=DB_POOL_MAX,
             **DB_CONFIG
         )
         logging.info(f"🐘 PostgreSQL connection pool created: {result.hostname}/{result.path[1:]}")
@@ -63,12 +72,133 @@ else:
     connection_pool = None
     logging.info("📁 Using SQLite (local development)")
 
+# ============================================================
+# POOL INSTRUMENTATION
+# ============================================================
+# ThreadedConnectionPool.getconn() raises PoolError when every connection is
+# checked out; the slot semaphore makes callers wait for a free connection
+# instead, and lets us measure how long they waited. Callers on the event-loop
+# thread (async handlers that still call _db_connect() directly) wait at most
+# DB_POOL_LOOP_WAIT_TIMEOUT, so a saturated pool fails that one call instead of
+# freezing every request on the worker.
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "acquired": 0,
+    "in_use": 0,
+    "peak_in_use": 0,
+    "wait_total_ms": 0.0,
+    "wait_max_ms": 0.0,
+    "errors": 0,
+    "loop_rejected": 0,
+}
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+def _pool_getconn():
+    """Take a connection from the pool, waiting for a free slot if needed"""
+    t0 = time.perf_counter()
+    on_loop = _on_event_loop()
+    timeout = DB_POOL_LOOP_WAIT_TIMEOUT if on_loop else DB_POOL_WAIT_TIMEOUT
+    acquired = _pool_slots.acquire(timeout=timeout) if timeout > 0 else _pool_slots.acquire(blocking=False)
+    if not acquired:
+        with _pool_stats_lock:
+            _pool_stats["errors"] += 1
+            if on_loop:
+                _pool_stats["loop_rejected"] += 1
+        raise TimeoutError(f"No pooled connection free after {timeout}s")
+    waited_ms = (time.perf_counter() - t0) * 1000.0
+    try:
+        conn = connection_pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        with _pool_stats_lock:
+            _pool_stats["errors"] += 1
+        raise
+    with _pool_stats_lock:
+        _pool_stats["acquired"] += 1
+        _pool_stats["in_use"] += 1
+        _pool_stats["peak_in_use"] = max(_pool_stats["peak_in_use"], _pool_stats["in_use"])
+        _pool_stats["wait_total_ms"] += waited_ms
+        _pool_stats["wait_max_ms"] = max(_pool_stats["wait_max_ms"], waited_ms)
+    return conn
+
+def _pool_putconn(conn):
+    """Return a connection taken with _pool_getconn()"""
+    try:
+        connection_pool.putconn(conn)
+    finally:
+        with _pool_stats_lock:
+            _pool_stats["in_use"] = max(0, _pool_stats["in_use"] - 1)
+        _pool_slots.release()
+
+def get_pool_stats() -> dict:
+    """Snapshot of pool usage for the admin metrics endpoint"""
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    acquired = stats["acquired"] or 1
+    stats["wait_avg_ms"] = round(stats["wait_total_ms"] / acquired, 3)
+    stats["wait_total_ms"] = round(stats["wait_total_ms"], 3)
+    stats["wait_max_ms"] = round(stats["wait_max_ms"], 3)
+    stats["max_size"] = DB_POOL_MAX
+    stats["backend"] = "postgresql" if USE_POSTGRES else "sqlite"
+    stats["pooled"] = bool(connection_pool)
+    stats["executor_workers"] = DB_POOL_MAX
+    return stats
+
+# ============================================================
+# ASYNC OFFLOADING
+# ============================================================
+# Blocking DB work runs on a dedicated executor sized to the pool so async
+# handlers never hold the event loop while a query is in flight.
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking DB function on the DB executor and await the result"""
+    loop = asyncio.get_running_loop()
+    if kwargs:
+        return await loop.run_in_executor(_db_executor, lambda: fn(*args, **kwargs))
+    return await loop.run_in_executor(_db_executor, fn, *args)
+
+class DBGate:
+    """Drop-in replacement for the old process-wide DB lock.
+
+    SQLite still needs writers serialized, so the gate is a real lock there.
+    With PostgreSQL every caller gets its own pooled connection, so the gate
+    lets callers through concurrently (the pool slots do the limiting).
+    """
+    def __init__(self):
+        self._lock = threading.Lock() if not (USE_POSTGRES and connection_pool) else None
+    
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock is None:
+            return True
+        return self._lock.acquire(blocking, timeout)
+    
+    def release(self):
+        if self._lock is not None:
+            self._lock.release()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+        return False
+
 class DatabaseConnection:
     """Unified database connection that works with both SQLite and PostgreSQL"""
     
     def __init__(self):
         self.conn = None
         self.is_postgres = USE_POSTGRES
+        self._pooled = False
     
     def connect(self, retry_count=3):
         """Establish database connection with retry logic for SSL errors"""
@@ -80,12 +210,14 @@ class DatabaseConnection:
                     # Use connection pool if available
                     if connection_pool:
                         try:
-                            self.conn = connection_pool.getconn()
+                            self.conn = _pool_getconn()
+                            self._pooled = True
                             self.conn.autocommit = False
                             return self.conn
                         except Exception as e:
                             logging.error(f"Failed to get connection from pool (attempt {attempt+1}/{retry_count}): {e}")
-                            if attempt < retry_count - 1:
+                            # On the event loop, skip the retry sleeps and go straight to a direct connection
+                            if attempt < retry_count - 1 and not _on_event_loop():
                                 time.sleep(1)  # Wait 1 second before retry
                                 continue
                     # Fallback to direct connection
@@ -107,16 +239,17 @@ class DatabaseConnection:
     def close(self):
         """Close database connection"""
         if self.conn:
-            if self.is_postgres and connection_pool:
+            if self.is_postgres and self._pooled:
                 # Return connection to pool
                 try:
-                    connection_pool.putconn(self.conn)
+                    _pool_putconn(self.conn)
                 except Exception as e:
                     logging.error(f"Failed to return connection to pool: {e}")
                     self.conn.close()
             else:
                 self.conn.close()
             self.conn = None
+            self._pooled = False
     
     def execute(self, query: str, params: tuple = None):
         """Execute a query with automatic dialect conversion"""
@@ -180,66 +313,308 @@ def get_db_connection():
     finally:
         db.close()
 
+# ============================================================
+# QUERY TRANSLATION CACHE (SQLite -> PostgreSQL)
+# ============================================================
+# The same handful of statements run on every request (settings, cache,
+# activity log, snapshots), so the translated text is memoized on the raw SQL.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512") or 512)
+_INSERT_OR_REPLACE_RX = re.compile(r'INSERT OR REPLACE INTO\s+(\w+)\s*\(([^)]+)\)', re.IGNORECASE)
+_INSERT_OR_REPLACE_KW_RX = re.compile(r'INSERT OR REPLACE INTO', re.IGNORECASE)
+_VALUES_RX = re.compile(r'VALUES\s*\([^)]+\)', re.IGNORECASE)
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def translate_query(query: str) -> str:
+    """Rewrite SQLite syntax used across the app into PostgreSQL syntax"""
+    # Convert SQLite ? placeholders to PostgreSQL %s
+    if '?' in query:
+        query = query.replace('?', '%s')
+    
+    # Convert SQLite AUTOINCREMENT to PostgreSQL SERIAL
+    if 'AUTOINCREMENT' in query.upper():
+        query = query.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+        query = query.replace('AUTOINCREMENT', '')
+    
+    # Convert SQLite INSERT OR REPLACE to PostgreSQL INSERT ... ON CONFLICT
+    if 'INSERT OR REPLACE INTO' in query.upper():
+        # Extract table name and columns
+        match = _INSERT_OR_REPLACE_RX.search(query)
+        if match:
+            columns = [col.strip() for col in match.group(2).split(',')]
+            
+            # Determine primary key column (usually first column or one ending with _key/id)
+            pk_column = columns[0]  # Default to first column
+            for col in columns:
+                if col.endswith('_key') or col.endswith('_id') or col == 'id' or col == 'key' or col == 'setting_key':
+                    pk_column = col
+                    break
+            
+            # Convert to PostgreSQL syntax
+            query = _INSERT_OR_REPLACE_KW_RX.sub('INSERT INTO', query)
+            
+            # Add ON CONFLICT clause if not already present
+            if 'ON CONFLICT' not in query.upper():
+                # Find the VALUES clause
+                values_match = _VALUES_RX.search(query)
+                if values_match:
+                    values_end = values_match.end()
+                    # Build UPDATE SET clause for all columns except primary key
+                    update_cols = [f"{col} = EXCLUDED.{col}" for col in columns if col != pk_column]
+                    on_conflict = f"\nON CONFLICT ({pk_column}) DO UPDATE SET\n    {', '.join(update_cols)}"
+                    query = query[:values_end] + on_conflict + query[values_end:]
+    return query
+
+def get_query_cache_stats() -> dict:
+    """Hit/miss counters of the translated-query cache"""
+    info = translate_query.cache_info()
+    total = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_rate": round(info.hits / total, 4) if total else 0.0,
+    }
+
+# ============================================================
+# BULK INGESTION (price_snapshots)
+# ============================================================
+# A scan of 13 durations x 2 locations x ~100 cars is thousands of rows;
+# one execute_values (PostgreSQL) / executemany (SQLite) per batch instead
+# of one INSERT round-trip per row.
+PRICE_SNAPSHOT_COLUMNS = (
+    "ts", "location", "pickup_date", "pickup_time", "days", "supplier",
+    "car", "price_text", "price_num", "currency", "link",
+)
+BULK_PAGE_SIZE = int(os.getenv("DB_BULK_PAGE_SIZE", "1000") or 1000)
+
+_ingest_stats_lock = threading.Lock()
+_ingest_stats = {
+    "batches": 0,
+    "rows": 0,
+    "seconds": 0.0,
+    "last_rows": 0,
+    "last_rows_per_second": 0.0,
+}
+
+def price_snapshot_rows(location: str, start_dt, days: int, items, currency: str, ts: Optional[str] = None) -> list:
+    """Convert scraped items into price_snapshots tuples (PRICE_SNAPSHOT_COLUMNS order)"""
+    if ts is None:
+        from datetime import datetime
+        ts = datetime.utcnow().isoformat(timespec="seconds")
+    pickup_date = start_dt.strftime("%Y-%m-%d")
+    pickup_time = start_dt.strftime("%H:%M")
+    return [
+        (
+            ts,
+            location,
+            pickup_date,
+            pickup_time,
+            int(days),
+            (it.get("supplier") or "").strip(),
+            (it.get("car") or "").strip(),
+            (it.get("price") or "").strip(),
+            it.get("price_num"),
+            currency or (it.get("currency") or ""),
+            (it.get("link") or "").strip(),
+        )
+        for it in items
+    ]
+
+def _raw_connection(conn):
+    """Unwrap PostgreSQLConnectionWrapper / DatabaseConnection to the driver connection"""
+    for attr in ("_conn", "conn"):
+        inner = getattr(conn, attr, None)
+        if inner is not None:
+            return inner
+    return conn
+
+def _is_postgres_raw(raw) -> bool:
+    return raw.__class__.__module__.startswith("psycopg2")
+
+def bulk_insert_rows(conn, table: str, columns, rows, page_size: int = BULK_PAGE_SIZE, on_conflict: str = "") -> int:
+    """Multi-row INSERT of ``rows`` (tuples in ``columns`` order); the caller owns the transaction
+
+    execute_values on PostgreSQL, executemany in pages on SQLite. ``on_conflict`` is
+    appended as-is (e.g. "ON CONFLICT (id) DO NOTHING"; same syntax on both).
+    Returns the row count passed in.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    raw = _raw_connection(conn)
+    column_list = ", ".join(columns)
+    suffix = f" {on_conflict}" if on_conflict else ""
+    if _is_postgres_raw(raw):
+        from psycopg2.extras import execute_values
+        with raw.cursor() as cur:
+            execute_values(cur, f"INSERT INTO {table} ({column_list}) VALUES %s{suffix}", rows, page_size=page_size)
+    else:
+        placeholders = ", ".join("?" for _ in columns)
+        sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}){suffix}"
+        for i in range(0, len(rows), page_size):
+            raw.executemany(sql, rows[i:i + page_size])
+    return len(rows)
+
+def bulk_insert_price_snapshots(conn, rows, page_size: int = BULK_PAGE_SIZE, groups=None) -> dict:
+    """Insert price_snapshots rows in batches; the caller owns the transaction (commit/rollback)
+
+    Accepts a raw psycopg2/sqlite3 connection or any of the wrappers. The daily
+    rollup (price_snapshot_daily) is updated in the same transaction; ``groups``
+    is the vehicle group of each row, if known. Returns
+    {"rows", "seconds", "rows_per_second"}.
+    """
+    rows = list(rows)
+    if not rows:
+        return {"rows": 0, "seconds": 0.0, "rows_per_second": 0.0}
+
+    raw = _raw_connection(conn)
+    started = time.perf_counter()
+    bulk_insert_rows(raw, "price_snapshots", PRICE_SNAPSHOT_COLUMNS, rows, page_size)
+    update_price_rollup(raw, rows, groups)
+    elapsed = time.perf_counter() - started
+
+    rate = round(len(rows) / elapsed, 1) if elapsed > 0 else float(len(rows))
+    with _ingest_stats_lock:
+        _ingest_stats["batches"] += 1
+        _ingest_stats["rows"] += len(rows)
+        _ingest_stats["seconds"] += elapsed
+        _ingest_stats["last_rows"] = len(rows)
+        _ingest_stats["last_rows_per_second"] = rate
+    logging.info(f"[BULK] price_snapshots: {len(rows)} rows in {elapsed * 1000:.1f} ms ({rate:.0f} rows/s)")
+    return {"rows": len(rows), "seconds": round(elapsed, 4), "rows_per_second": rate}
+
+# ============================================================
+# DAILY ROLLUP (price_snapshot_daily)
+# ============================================================
+# /api/price-history reads MIN/AVG/MAX per day, location and month from here
+# instead of aggregating price_snapshots on every request. AVG is kept as
+# sum_price / n so any regrouping gives the same value as AVG() over the raw rows.
+# Only rows with price_num > 0 are counted (same filter as the charts).
+PRICE_ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS price_snapshot_daily (
+      day TEXT NOT NULL,
+      location TEXT NOT NULL,
+      days INTEGER NOT NULL,
+      car_group TEXT NOT NULL DEFAULT '',
+      supplier TEXT NOT NULL DEFAULT '',
+      n INTEGER NOT NULL,
+      sum_price DOUBLE PRECISION NOT NULL,
+      min_price DOUBLE PRECISION NOT NULL,
+      max_price DOUBLE PRECISION NOT NULL,
+      PRIMARY KEY (day, location, days, car_group, supplier)
+    )
+"""
+_ROLLUP_COLUMNS = "day, location, days, car_group, supplier, n, sum_price, min_price, max_price"
+_ROLLUP_UPSERT = (
+    "ON CONFLICT (day, location, days, car_group, supplier) DO UPDATE SET "
+    "n = price_snapshot_daily.n + excluded.n, "
+    "sum_price = price_snapshot_daily.sum_price + excluded.sum_price, "
+    "min_price = {least}(price_snapshot_daily.min_price, excluded.min_price), "
+    "max_price = {greatest}(price_snapshot_daily.max_price, excluded.max_price)"
+)
+
+def ensure_price_rollup_table(conn) -> None:
+    raw = _raw_connection(conn)
+    if _is_postgres_raw(raw):
+        with raw.cursor() as cur:
+            cur.execute(PRICE_ROLLUP_DDL)
+    else:
+        raw.execute(PRICE_ROLLUP_DDL)
+
+def _aggregate_snapshot_rows(rows, groups=None) -> list:
+    """price_snapshots tuples → rollup tuples (one per day/location/days/group/supplier)"""
+    # Índices em PRICE_SNAPSHOT_COLUMNS
+    TS, LOCATION, DAYS, SUPPLIER, PRICE = 0, 1, 4, 5, 8
+    agg = {}
+    for i, row in enumerate(rows):
+        price = row[PRICE]
+        if price is None or price <= 0:
+            continue
+        group = (groups[i] if groups else "") or ""
+        key = (str(row[TS])[:10], row[LOCATION], int(row[DAYS]), group, row[SUPPLIER] or "")
+        cur = agg.get(key)
+        if cur is None:
+            agg[key] = [1, price, price, price]
+        else:
+            cur[0] += 1
+            cur[1] += price
+            if price < cur[2]:
+                cur[2] = price
+            if price > cur[3]:
+                cur[3] = price
+    return [key + tuple(vals) for key, vals in agg.items()]
+
+def update_price_rollup(conn, rows, groups=None) -> int:
+    """Fold freshly inserted price_snapshots rows into price_snapshot_daily (caller commits)"""
+    rollup = _aggregate_snapshot_rows(rows, groups)
+    if not rollup:
+        return 0
+    raw = _raw_connection(conn)
+    if _is_postgres_raw(raw):
+        from psycopg2.extras import execute_values
+        upsert = _ROLLUP_UPSERT.format(least="LEAST", greatest="GREATEST")
+        with raw.cursor() as cur:
+            execute_values(cur, f"INSERT INTO price_snapshot_daily ({_ROLLUP_COLUMNS}) VALUES %s {upsert}", rollup)
+    else:
+        upsert = _ROLLUP_UPSERT.format(least="MIN", greatest="MAX")
+        raw.executemany(
+            f"INSERT INTO price_snapshot_daily ({_ROLLUP_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) {upsert}",
+            rollup,
+        )
+    return len(rollup)
+
+def backfill_price_rollup(conn) -> int:
+    """Rebuild price_snapshot_daily from all of price_snapshots (caller commits)
+
+    price_snapshots has no group column, so historical rows land in car_group ''.
+    Returns the number of rollup rows written.
+    """
+    ensure_price_rollup_table(conn)
+    day_expr = "SUBSTR(CAST(ts AS TEXT), 1, 10)"
+    sql = f"""
+        INSERT INTO price_snapshot_daily ({_ROLLUP_COLUMNS})
+        SELECT {day_expr}, location, days, '', COALESCE(supplier, ''),
+               COUNT(*), SUM(price_num), MIN(price_num), MAX(price_num)
+        FROM price_snapshots
+        WHERE price_num IS NOT NULL AND price_num > 0
+        GROUP BY {day_expr}, location, days, COALESCE(supplier, '')
+    """
+    raw = _raw_connection(conn)
+    if _is_postgres_raw(raw):
+        with raw.cursor() as cur:
+            cur.execute("DELETE FROM price_snapshot_daily")
+            cur.execute(sql)
+            cur.execute("SELECT COUNT(*) FROM price_snapshot_daily")
+            return cur.fetchone()[0]
+    raw.execute("DELETE FROM price_snapshot_daily")
+    raw.execute(sql)
+    return raw.execute("SELECT COUNT(*) FROM price_snapshot_daily").fetchone()[0]
+
+def get_ingest_stats() -> dict:
+    with _ingest_stats_lock:
+        stats = dict(_ingest_stats)
+    stats["rows_per_second"] = round(stats["rows"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+    stats["seconds"] = round(stats["seconds"], 4)
+    return stats
+
 class PostgreSQLConnectionWrapper:
     """Wrapper to add execute() method to PostgreSQL connection"""
-    def __init__(self, conn):
+    def __init__(self, conn, pooled: bool = False):
         self._conn = conn
         self._cursor = None
+        self._pooled = pooled
     
     def execute(self, query, params=None):
         """Execute query using cursor"""
-        # Convert SQLite ? placeholders to PostgreSQL %s
-        if '?' in query:
-            # Count number of ? to ensure we have right number of params
-            num_placeholders = query.count('?')
-            query = query.replace('?', '%s')
-            
-            # Ensure params is a tuple
-            if params is not None:
-                if not isinstance(params, (tuple, list)):
-                    params = (params,)
-                elif isinstance(params, list):
-                    params = tuple(params)
-        
-        # Convert SQLite AUTOINCREMENT to PostgreSQL SERIAL
-        if 'AUTOINCREMENT' in query.upper():
-            query = query.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
-            query = query.replace('AUTOINCREMENT', '')
+        # Ensure params is a tuple for %s placeholders
+        if params is not None and '?' in query:
+            if not isinstance(params, (tuple, list)):
+                params = (params,)
+            elif isinstance(params, list):
+                params = tuple(params)
         
-        # Convert SQLite INSERT OR REPLACE to PostgreSQL INSERT ... ON CONFLICT
-        if 'INSERT OR REPLACE INTO' in query.upper():
-            import re
-            # Extract table name and columns
-            match = re.search(r'INSERT OR REPLACE INTO\s+(\w+)\s*\(([^)]+)\)', query, re.IGNORECASE)
-            if match:
-                table_name = match.group(1)
-                columns = [col.strip() for col in match.group(2).split(',')]
-                
-                # Determine primary key column (usually first column or one ending with _key/id)
-                pk_column = columns[0]  # Default to first column
-                for col in columns:
-                    if col.endswith('_key') or col.endswith('_id') or col == 'id' or col == 'key' or col == 'setting_key':
-                        pk_column = col
-                        break
-                
-                # Convert to PostgreSQL syntax
-                query = re.sub(
-                    r'INSERT OR REPLACE INTO',
-                    'INSERT INTO',
-                    query,
-                    flags=re.IGNORECASE
-                )
-                
-                # Add ON CONFLICT clause if not already present
-                if 'ON CONFLICT' not in query.upper():
-                    # Find the VALUES clause
-                    values_match = re.search(r'VALUES\s*\([^)]+\)', query, re.IGNORECASE)
-                    if values_match:
-                        values_end = values_match.end()
-                        # Build UPDATE SET clause for all columns except primary key
-                        update_cols = [f"{col} = EXCLUDED.{col}" for col in columns if col != pk_column]
-                        on_conflict = f"\nON CONFLICT ({pk_column}) DO UPDATE SET\n    {', '.join(update_cols)}"
-                        query = query[:values_end] + on_conflict + query[values_end:]
+        query = translate_query(query)
         
         self._cursor = self._conn.cursor()
         try:
@@ -249,7 +624,6 @@ class PostgreSQLConnectionWrapper:
                 self._cursor.execute(query)
         except Exception as e:
             # Log the error with query and params for debugging
-            import logging
             logging.error(f"PostgreSQL execute error: {e}")
             logging.error(f"Query: {query}")
             logging.error(f"Params: {params}")
@@ -269,13 +643,15 @@ class PostgreSQLConnectionWrapper:
     def close(self):
         if self._cursor:
             self._cursor.close()
-        if connection_pool and self._conn:
+            self._cursor = None
+        if self._pooled and self._conn:
             try:
-                connection_pool.putconn(self._conn)
+                _pool_putconn(self._conn)
             except:
                 self._conn.close()
         elif self._conn:
             self._conn.close()
+        self._conn = None
     
     def __enter__(self):
         return self
@@ -288,20 +664,30 @@ class PostgreSQLConnectionWrapper:
 def get_db():
     """Get a database connection (for backward compatibility)"""
     if USE_POSTGRES:
+        pooled = False
         if connection_pool:
             try:
-                conn = connection_pool.getconn()
+                conn = _pool_getconn()
+                pooled = True
             except:
                 conn = psycopg2.connect(**DB_CONFIG)
         else:
             conn = psycopg2.connect(**DB_CONFIG)
         # Wrap to add execute() method
-        return PostgreSQLConnectionWrapper(conn)
+        return PostgreSQLConnectionWrapper(conn, pooled=pooled)
     else:
         conn = sqlite3.connect("data.db", check_same_thread=False)
         conn.row_factory = sqlite3.Row
         return conn
 
+def listen_connection():
+    """Dedicated autocommit PostgreSQL connection for LISTEN (outside the pool); None on SQLite"""
+    if not USE_POSTGRES:
+        return None
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    return conn
+
 # Legacy support - keep existing _db_connect function working
 def _db_connect():
     """Legacy database connection function"""
@@ -32,7 +32,7 @@ echo "1. Para adicionar mais 154 mapeamentos:"
 echo "   python3 generate_missing_mappings.py"
 echo ""
 echo "2. Para forçar download das imagens (servidor deve estar rodando):"
-echo "   curl -X POST http://localhost:8000/api/vehicles/images/download"
+echo "   curl -X POST \"http://localhost:8000/api/vehicles/images/download?wait=1\""
 echo ""
 echo "3. Para ver detalhes completos:"
 echo "   python3 diagnose_photos.py"
@@ -0,0 +1,111 @@
+"""
+Variantes redimensionadas/convertidas das fotos de carros (thumbnails WebP/AVIF)
+
+Funções puras sobre bytes, sem dependências da app: correm nos processos do pool
+de main.py (spawn -> os workers só importam este módulo e o Pillow).
+
+AVIF só existe com um Pillow com AVIF (>= 11.2) ou com pillow-avif-plugin
+instalado; sem isso o pedido "auto" cai para WebP.
+"""
+
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+try:
+    import pillow_avif  # noqa: F401  (regista o encoder AVIF em Pillow < 11.2)
+except ImportError:
+    pass
+
+# Larguras permitidas: pedidos arbitrários são arredondados para cima (cache limitada)
+WIDTHS = (48, 64, 96, 128, 160, 192, 240, 320, 480, 640, 960, 1280)
+
+CONTENT_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+PIL_FORMATS = {"avif": "AVIF", "webp": "WEBP", "jpeg": "JPEG", "png": "PNG"}
+FORMATS = ("auto", "original") + tuple(CONTENT_TYPES)
+
+
+def avif_supported() -> bool:
+    Image.init()
+    return "AVIF" in Image.SAVE
+
+
+def snap_width(width):
+    """Largura pedida -> a largura permitida seguinte (None = sem redimensionar)"""
+    if not width or width <= 0:
+        return None
+    for allowed in WIDTHS:
+        if width <= allowed:
+            return allowed
+    return WIDTHS[-1]
+
+
+def source_format(content_type: str) -> str:
+    ct = (content_type or "").lower()
+    if "png" in ct or "gif" in ct:
+        return "png"
+    if "webp" in ct:
+        return "webp"
+    if "avif" in ct:
+        return "avif"
+    return "jpeg"
+
+
+def negotiate(requested: str, accept: str, content_type: str, avif: bool) -> str:
+    """Formato de saída: 'auto' escolhe pelo Accept do browser, 'original' mantém o da fonte"""
+    requested = (requested or "original").lower()
+    if requested == "auto":
+        accept = (accept or "").lower()
+        if avif and "image/avif" in accept:
+            return "avif"
+        if "image/webp" in accept:
+            return "webp"
+        return source_format(content_type)
+    if requested == "original" or (requested == "avif" and not avif):
+        return source_format(content_type)
+    return requested
+
+
+def render_variant(data: bytes, width, fmt: str):
+    """(bytes, content_type) da variante; devolve None se não compensar (imagem já pequena/igual)"""
+    im = Image.open(BytesIO(data))
+    if getattr(im, "is_animated", False):
+        return None
+    if width and im.format == "JPEG":
+        # Descodifica já reduzido (DCT scaling) -> muito menos trabalho em fotos grandes
+        im.draft("RGB", (width, max(1, im.height * width // max(1, im.width))))
+    im = ImageOps.exif_transpose(im)
+    resized = bool(width) and im.width > width
+    if resized:
+        height = max(1, round(im.height * width / im.width))
+        im = im.resize((width, height), Image.LANCZOS)
+
+    has_alpha = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+    if fmt == "jpeg":
+        if has_alpha:
+            background = Image.new("RGB", im.size, (255, 255, 255))
+            background.paste(im.convert("RGBA"), mask=im.convert("RGBA").split()[-1])
+            im = background
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        options = {"quality": 82, "optimize": True, "progressive": True}
+    elif fmt == "png":
+        options = {"optimize": True}
+    elif fmt == "webp":
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        options = {"quality": 80, "method": 4}
+    else:  # avif
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        options = {"quality": 60, "speed": 6}
+
+    out = BytesIO()
+    im.save(out, PIL_FORMATS[fmt], **options)
+    encoded = out.getvalue()
+    if not resized and len(encoded) >= len(data):
+        return None
+    return encoded, CONTENT_TYPES[fmt]
@@ -7,6 +7,8 @@
 """
 
 from datetime import datetime
+from functools import lru_cache
+from html import escape
 import os
 import re
 
@@ -172,7 +174,8 @@ def fix_photo_url_for_email(photo_url, car_name=None):
         
         # Construct URL to internal photo endpoint
         # This endpoint serves photos from vehicle_images table
-        internal_photo_url = f"{base_url}/api/vehicles/{vehicle_key}/photo"
+        # w=170: thumbnail para as <img> de 85px (2x); formato original (Outlook não lê WebP)
+        internal_photo_url = f"{base_url}/api/vehicles/{vehicle_key}/photo?w=170"
         
         # Return internal URL - the endpoint will handle fallbacks internally
         # (tries vehicle_images, then vehicle_photos, then variations)
@@ -199,8 +202,10 @@ COLOR_ORANGE = "#f59e0b"       # Laranja (competitivo)
 COLOR_RED = "#ef4444"          # Vermelho (alerta)
 COLOR_GRAY = "#94a3b8"         # Cinza
 
+
+@lru_cache(maxsize=128)
 def generate_report_header(title, subtitle=""):
-    """Header padrão para todos os relatórios (igual ao DR)"""
+    """Header padrão para todos os relatórios (igual ao DR); o HTML é guardado por (title, subtitle)"""
     return f"""
     <!DOCTYPE html>
     <html>
@@ -356,23 +361,65 @@ def generate_report_header(title, subtitle=""):
             <div class="content">
     """
 
-def generate_report_footer():
-    """Footer padrão - BARRA AZUL + texto ABAIXO (fora da barra)"""
+# Textos dos relatórios por língua (pt = os textos de sempre)
+REPORT_LABELS = {
+    'pt': {
+        'daily_title': 'Relatório Diário',
+        'weekly_title': 'Relatório Semanal',
+        'week': 'Semana',
+        'date_format': '%d de %B de %Y',
+        'day': 'dia',
+        'days': 'dias',
+        'best_badge': 'MELHOR',
+        'best_prices': 'Melhores Preços',
+        'competitive': 'Competitivos',
+        'leadership': 'Taxa de Liderança',
+        'no_data': 'Sem dados de pesquisa disponíveis',
+        'no_data_hint': 'Execute uma pesquisa para gerar relatórios',
+        'no_location_data': 'Sem dados para {location}',
+        'footer_system': 'Sistema de Monitorização de Preços',
+        'footer_note': 'Dados baseados na última pesquisa • Atualizado automaticamente',
+    },
+    'en': {
+        'daily_title': 'Daily Report',
+        'weekly_title': 'Weekly Report',
+        'week': 'Week',
+        'date_format': '%B %d, %Y',
+        'day': 'day',
+        'days': 'days',
+        'best_badge': 'BEST',
+        'best_prices': 'Best Prices',
+        'competitive': 'Competitive',
+        'leadership': 'Leadership Rate',
+        'no_data': 'No search data available',
+        'no_data_hint': 'Run a search to generate reports',
+        'no_location_data': 'No data for {location}',
+        'footer_system': 'Price Monitoring System',
+        'footer_note': 'Based on the latest search • Updated automatically',
+    },
+}
+
+def _labels(lang):
+    return REPORT_LABELS.get(lang) or REPORT_LABELS['pt']
+
+@lru_cache(maxsize=16)
+def _report_footer(year, lang):
+    labels = _labels(lang)
     return f"""
             </div>
             <!-- Footer: Barra azul -->
             <div style="background: {COLOR_PRIMARY}; padding: 20px; text-align: center;">
                 <p style="margin: 0; font-size: 14px; color: #fff; font-weight: 500;">
-                    Auto Prudente © {datetime.now().year}
+                    Auto Prudente © {year}
                 </p>
             </div>
             <!-- Texto ABAIXO da barra azul (fora) -->
             <div style="background: #f8fafc; padding: 20px; text-align: center;">
                 <p style="margin: 0; font-size: 12px; color: #64748b; font-weight: 500;">
-                    Sistema de Monitorização de Preços
+                    {labels['footer_system']}
                 </p>
                 <p style="margin: 10px 0 0 0; font-size: 11px; color: #94a3b8;">
-                    Dados baseados na última pesquisa • Atualizado automaticamente
+                    {labels['footer_note']}
                 </p>
             </div>
         </div>
@@ -380,511 +427,310 @@ def generate_report_footer():
     </html>
     """
 
-def generate_daily_report_html_by_location(search_data, location):
-    """
-    Generate visual HTML report for ONE location only
-    Shows ALL selected days from settings
-    ORGANIZED BY DAYS FIRST (1 day → all groups, 2 days → all groups, etc)
-    """
-    # SVG Icons (monocromáticos)
-    icon_car = '<svg width="18" height="18" fill="currentColor" viewBox="0 0 24 24"><path d="M18.92 6.01C18.72 5.42 18.16 5 17.5 5h-11c-.66 0-1.21.42-1.42 1.01L3 12v8c0 .55.45 1 1 1h1c.55 0 1-.45 1-1v-1h12v1c0 .55.45 1 1 1h1c.55 0 1-.45 1-1v-8l-2.08-5.99zM6.5 16c-.83 0-1.5-.67-1.5-1.5S5.67 13 6.5 13s1.5.67 1.5 1.5S7.33 16 6.5 16zm11 0c-.83 0-1.5-.67-1.5-1.5s.67-1.5 1.5-1.5 1.5.67 1.5 1.5-.67 1.5-1.5 1.5zM5 11l1.5-4.5h11L19 11H5z"/></svg>'
-    icon_trophy = '<svg width="18" height="18" fill="currentColor" viewBox="0 0 24 24"><path d="M20 7h-2V5c0-1.1-.9-2-2-2H8c-1.1 0-2 .9-2 2v2H4c-1.1 0-2 .9-2 2v3c0 2.5 1.5 4.7 3.8 5.7.5 1.7 1.8 3 3.5 3.7V23h5v-1.6c1.7-.7 3-2 3.5-3.7 2.3-1 3.8-3.2 3.8-5.7V9c0-1.1-.9-2-2-2zm0 5c0 1.9-1.2 3.5-2.9 4.1-.2-1.3-.8-2.4-1.7-3.3l-1.4 1.4c.6.6 1 1.5 1 2.4 0 1.9-1.6 3.5-3.5 3.5S8 18.5 8 16.6c0-.9.4-1.8 1-2.4L7.6 12.8c-.9.9-1.5 2-1.7 3.3C4.2 15.5 3 13.9 3 12V9h3V5h12v4h3v3z"/></svg>'
-    icon_calendar = '<svg width="16" height="16" fill="currentColor" viewBox="0 0 24 24"><path d="M19 4h-1V2h-2v2H8V2H6v2H5c-1.1 0-2 .9-2 2v14c0 1.1.9 2 2 2h14c1.1 0 2-.9 2-2V6c0-1.1-.9-2-2-2zm0 16H5V10h14v10zM5 8V6h14v2H5z"/></svg>'
-    icon_location = '<svg width="16" height="16" fill="currentColor" viewBox="0 0 24 24"><path d="M12 2C8.13 2 5 5.13 5 9c0 5.25 7 13 7 13s7-7.75 7-13c0-3.87-3.13-7-7-7zm0 9.5c-1.38 0-2.5-1.12-2.5-2.5s1.12-2.5 2.5-2.5 2.5 1.12 2.5 2.5-1.12 2.5-2.5 2.5z"/></svg>'
-    
-    if not search_data or not search_data.get('results'):
-        html = generate_report_header(
-            f"Relatório Diário - {location}",
-            datetime.now().strftime('%d de %B de %Y')
-        )
-        html += """
-        <div style="text-align: center; padding: 40px;">
-            <p style="color: #ef4444; font-size: 16px;">Sem dados de pesquisa disponíveis</p>
-            <p style="color: #94a3b8; font-size: 14px;">Execute uma pesquisa para gerar relatórios</p>
+def generate_report_footer(lang='pt'):
+    """Footer padrão - BARRA AZUL + texto ABAIXO (fora da barra)"""
+    return _report_footer(datetime.now().year, lang)
+
+# SVG Icons (monocromáticos)
+ICON_CAR = '<svg width="18" height="18" fill="currentColor" viewBox="0 0 24 24"><path d="M18.92 6.01C18.72 5.42 18.16 5 17.5 5h-11c-.66 0-1.21.42-1.42 1.01L3 12v8c0 .55.45 1 1 1h1c.55 0 1-.45 1-1v-1h12v1c0 .55.45 1 1 1h1c.55 0 1-.45 1-1v-8l-2.08-5.99zM6.5 16c-.83 0-1.5-.67-1.5-1.5S5.67 13 6.5 13s1.5.67 1.5 1.5S7.33 16 6.5 16zm11 0c-.83 0-1.5-.67-1.5-1.5s.67-1.5 1.5-1.5 1.5.67 1.5 1.5-.67 1.5-1.5 1.5zM5 11l1.5-4.5h11L19 11H5z"/></svg>'
+ICON_TROPHY = '<svg width="18" height="18" fill="currentColor" viewBox="0 0 24 24"><path d="M20 7h-2V5c0-1.1-.9-2-2-2H8c-1.1 0-2 .9-2 2v2H4c-1.1 0-2 .9-2 2v3c0 2.5 1.5 4.7 3.8 5.7.5 1.7 1.8 3 3.5 3.7V23h5v-1.6c1.7-.7 3-2 3.5-3.7 2.3-1 3.8-3.2 3.8-5.7V9c0-1.1-.9-2-2-2zm0 5c0 1.9-1.2 3.5-2.9 4.1-.2-1.3-.8-2.4-1.7-3.3l-1.4 1.4c.6.6 1 1.5 1 2.4 0 1.9-1.6 3.5-3.5 3.5S8 18.5 8 16.6c0-.9.4-1.8 1-2.4L7.6 12.8c-.9.9-1.5 2-1.7 3.3C4.2 15.5 3 13.9 3 12V9h3V5h12v4h3v3z"/></svg>'
+ICON_CALENDAR = '<svg width="16" height="16" fill="currentColor" viewBox="0 0 24 24"><path d="M19 4h-1V2h-2v2H8V2H6v2H5c-1.1 0-2 .9-2 2v14c0 1.1.9 2 2 2h14c1.1 0 2-.9 2-2V6c0-1.1-.9-2-2-2zm0 16H5V10h14v10zM5 8V6h14v2H5z"/></svg>'
+
+# Fragmentos do relatório: cores e ícones substituídos uma vez no import, por
+# carro/grupo só falta format() com valores já escapados (html.escape, em C).
+_STATS_HTML = """
+    <div class="stats-box">
+        <div class="stat">
+            <div class="stat-value" style="color: {primary};">{{best}}</div>
+            <div class="stat-label">{{best_label}}</div>
         </div>
-        """
-        html += generate_report_footer()
-        return html
-    
-    # Filter results by location
-    results = [r for r in search_data['results'] if r.get('location', '').lower() == location.lower()]
-    
-    if not results:
-        html = generate_report_header(
-            f"Relatório Diário - {location}",
-            datetime.now().strftime('%d de %B de %Y')
-        )
-        html += f"""
-        <div style="text-align: center; padding: 40px;">
-            <p style="color: #94a3b8; font-size: 16px;">Sem dados para {location}</p>
+        <div class="stat">
+            <div class="stat-value" style="color: #92400e;">{{competitive}}</div>
+            <div class="stat-label">{{competitive_label}}</div>
         </div>
-        """
-        html += generate_report_footer()
-        return html
-    
-    # Group by DAYS first, then by GROUP
-    data_by_days = {}
-    for car in results:
-        days = car.get('days', 1)
-        group = car.get('group', 'Unknown')
-        
-        if days not in data_by_days:
-            data_by_days[days] = {}
-        
-        if group not in data_by_days[days]:
-            data_by_days[days][group] = []
-        
-        data_by_days[days][group].append(car)
-    
-    # Find the lowest price PER DAY (not global)
-    lowest_price_per_day = {}
-    for days, groups in data_by_days.items():
-        all_prices_for_day = []
-        for group, cars in groups.items():
-            for car in cars:
-                all_prices_for_day.append(float(car.get('price_num', 999999)))
-        lowest_price_per_day[days] = min(all_prices_for_day) if all_prices_for_day else 999999
-    
-    # Stats
-    ap_best_price = 0
-    ap_competitive = 0
-    total_searches = 0
-    
-    # Generate HTML
-    html = generate_report_header(
-        f"Relatório Diário - {location}",
-        datetime.now().strftime('%d de %B de %Y')
-    )
-    
-    # Sort days
-    sorted_days = sorted(data_by_days.keys())
-    
-    content_html = ""
-    
-    for days in sorted_days:
-        groups = data_by_days[days]
-        
-        # BARRA AZUL - Separador de dias
-        content_html += f"""
-        <div style="background: {COLOR_PRIMARY}; padding: 15px 20px; margin: 30px 0 20px 0; border-radius: 6px;">
+        <div class="stat">
+            <div class="stat-value">{{percentage}}%</div>
+            <div class="stat-label">{{leadership_label}}</div>
+        </div>
+    </div>
+    """.format(primary=COLOR_PRIMARY)
+
+_MONTH_BAR_HTML = """
+        <div style="background: {primary}; padding: 20px 20px; margin: 30px 0 20px 0; border-radius: 6px;">
+            <div style="color: #fff; font-size: 22px; font-weight: bold; display: flex; align-items: center; gap: 8px;">
+                {calendar} {{month}}
+            </div>
+        </div>
+        """.format(primary=COLOR_PRIMARY, calendar=ICON_CALENDAR)
+
+# Diário: barra dos dias no topo; semanal: dentro do mês (mais pequena)
+_DAY_BAR_HTML = {
+    kind: """
+        <div style="background: {primary}; padding: 15px 20px; margin: {margin}; border-radius: 6px;{opacity}">
             <div style="color: #fff; font-size: 18px; font-weight: bold; display: flex; align-items: center; gap: 8px;">
-                {icon_calendar} {days} dia{'s' if days > 1 else ''}
+                {calendar} {{days}} {{days_label}}
             </div>
         </div>
-        """
-        
-        # Sort groups
-        for group in sorted(groups.keys()):
-            cars = groups[group]
-            total_searches += 1
-            
-            # Sort cars by price
-            sorted_cars = sorted(cars, key=lambda x: float(x.get('price_num', 999999)))
-            
-            # Find Auto Prudente position
-            ap_position = None
-            for idx, car in enumerate(sorted_cars, 1):
-                supplier_raw = (car.get('supplier', '') or '')
-                supplier_name = display_supplier_name(supplier_raw).lower()
-                if 'auto prudente' in supplier_name or 'autoprudente' in supplier_raw.lower() or supplier_raw.upper() == 'AUP':
-                    ap_position = idx
-                    break
-            
-            if ap_position == 1:
-                ap_best_price += 1
-                position_bg = COLOR_PRIMARY  # AZUL do website em vez de verde
-                position_text = "1º"
-                position_icon = icon_trophy
-            elif ap_position == 2:
-                ap_competitive += 1
-                position_bg = COLOR_ORANGE
-                position_text = "2º"
-                position_icon = icon_trophy
-            elif ap_position == 3:
-                ap_competitive += 1
-                position_bg = COLOR_YELLOW
-                position_text = "3º"
-                position_icon = icon_trophy
-            elif ap_position and ap_position <= 5:
-                position_bg = COLOR_GRAY
-                position_text = f"{ap_position}º"
-                position_icon = ""
-            elif ap_position:
-                position_bg = COLOR_RED
-                position_text = f"{ap_position}º"
-                position_icon = ""
-            else:
-                position_bg = COLOR_GRAY
-                position_text = "N/A"
-                position_icon = ""
-            
-            # Cor do texto (branco ou escuro)
-            text_color = "#fff" if position_bg not in [COLOR_YELLOW] else "#92400e"
-            
-            # BARRA AMARELA pequena - Separador de grupos
-            content_html += f"""
-            <div style="background: {COLOR_YELLOW}; height: 3px; margin: 15px 0 15px 0;"></div>
-            """
-            
-            # Group card
-            content_html += f"""
+        """.format(primary=COLOR_PRIMARY, calendar=ICON_CALENDAR, margin=margin, opacity=opacity)
+    for kind, margin, opacity in (('daily', '30px 0 20px 0', ''), ('weekly', '25px 0 15px 0', ' opacity: 0.9;'))
+}
+
+_GROUP_OPEN_HTML = """
+            <div style="background: {yellow}; height: 3px; margin: 15px 0 15px 0;"></div>
             <div class="group-card">
                 <div class="group-header">
                     <div style="display: flex; align-items: center; gap: 10px;">
-                        {icon_car}
-                        <span class="group-name">{group}</span>
+                        {car_icon}
+                        <span class="group-name">{{name}}</span>
                     </div>
-                    <div style="display: flex; align-items: center; gap: 8px; background: {position_bg}; color: {text_color}; padding: 8px 16px; border-radius: 6px; font-size: 14px; font-weight: 600; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
-                        {position_icon}
-                        <span>{position_text}</span>
+                    <div style="display: flex; align-items: center; gap: 8px; background: {{position_bg}}; color: {{text_color}}; padding: 8px 16px; border-radius: 6px; font-size: 14px; font-weight: 600; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
+                        {{position_icon}}
+                        <span>{{position_text}}</span>
                     </div>
                 </div>
                 <div class="price-comparison">
-            """
-            
-            # Top 5 competitors
-            for idx, car in enumerate(sorted_cars[:5], 1):
-                supplier_raw = car.get('supplier', 'Unknown')
-                supplier = display_supplier_name(supplier_raw)  # Traduzir código para nome real
-                price = float(car.get('price_num', 0))
-                is_ap = 'auto prudente' in supplier.lower() or 'autoprudente' in supplier_raw.lower()
-                
-                # Imagem REAL do carro (campo 'photo' do CarJet)
-                car_photo = car.get('photo', '')
-                car_name = car.get('car', 'Unknown')
-                
-                # Fix photo URL for email - PRIORITY: vehicle_images DB, then CarJet CDN
-                # Pass car_name to lookup in vehicle_images table
-                fixed_photo = fix_photo_url_for_email(car_photo, car_name=car_name)
-                
-                # Usar imagem REAL se disponível
-                if fixed_photo:
-                    car_visual = f'<img src="{fixed_photo}" alt="{car_name}" style="width: 85px; max-height: 60px; object-fit: contain; border-radius: 8px; box-shadow: 0 2px 6px rgba(0,0,0,0.15);">'
-                else:
-                    # Fallback: ícone SVG pequeno
-                    car_visual = icon_car
-                
-                # Check if this is the lowest price FOR THIS DAY
-                is_lowest = abs(price - lowest_price_per_day[days]) < 0.01
-                
-                # Badge for lowest price - below price
-                price_badge = ''
-                if is_lowest:
-                    price_badge = '<div style="margin-top: 4px;"><span style="display: inline-block; background: #f4ad0f; color: #fff; padding: 3px 8px; border-radius: 4px; font-size: 10px; font-weight: bold;">MELHOR</span></div>'
-                
-                content_html += f"""
-                <div class="competitor {'autoprudente' if is_ap else ''}">
+            """.format(yellow=COLOR_YELLOW, car_icon=ICON_CAR)
+
+_COMPETITOR_HTML = """
+                <div class="competitor {css}">
                     <!-- Foto à esquerda -->
                     <div style="flex-shrink: 0; width: 90px; display: flex; align-items: flex-start; justify-content: center;">
-                        {car_visual}
+                        {visual}
                     </div>
                     
                     <!-- Info do supplier e carro (grow) -->
                     <div style="flex: 1; min-width: 0;">
-                        <div style="font-weight: {'bold' if is_ap else '600'}; color: {'#009cb6' if is_ap else '#1e293b'}; font-size: 13px; margin-bottom: 4px; line-height: 1.4;">
+                        <div style="font-weight: {weight}; color: {color}; font-size: 13px; margin-bottom: 4px; line-height: 1.4;">
                             {idx}. {supplier}
                         </div>
                         <div style="font-size: 12px; color: #64748b; line-height: 1.4;">
-                            {car_name}
+                            {name}
                         </div>
                     </div>
                     
                     <!-- Preço centralizado verticalmente -->
                     <div style="flex-shrink: 0; display: flex; flex-direction: column; align-items: center; justify-content: center; min-width: 100px;">
-                        <div style="font-size: 14px; font-weight: bold; color: {'#009cb6' if is_ap else '#1e293b'}; white-space: nowrap; text-align: center;">
-                            {price:.2f}€
+                        <div style="font-size: 14px; font-weight: bold; color: {color}; white-space: nowrap; text-align: center;">
+                            {price}€
                         </div>
-                        {price_badge}
+                        {badge}
                     </div>
                 </div>
                 """
-            
-            content_html += """
+
+_PHOTO_HTML = '<img src="{src}" alt="{alt}" style="width: 85px; max-height: 60px; object-fit: contain; border-radius: 8px; box-shadow: 0 2px 6px rgba(0,0,0,0.15);">'
+_BEST_BADGE_HTML = '<div style="margin-top: 4px;"><span style="display: inline-block; background: #f4ad0f; color: #fff; padding: 3px 8px; border-radius: 4px; font-size: 10px; font-weight: bold;">{label}</span></div>'
+
+_GROUP_CLOSE_HTML = """
                 </div>
             </div>
             """
-    
-    # Calculate percentage
-    ap_percentage = (ap_best_price / total_searches * 100) if total_searches > 0 else 0
-    
-    # Add stats
-    stats_html = f"""
-    <div class="stats-box">
-        <div class="stat">
-            <div class="stat-value" style="color: {COLOR_PRIMARY};">{ap_best_price}</div>
-            <div class="stat-label">Melhores Preços</div>
-        </div>
-        <div class="stat">
-            <div class="stat-value" style="color: #92400e;">{ap_competitive}</div>
-            <div class="stat-label">Competitivos</div>
-        </div>
-        <div class="stat">
-            <div class="stat-value">{ap_percentage:.0f}%</div>
-            <div class="stat-label">Taxa de Liderança</div>
+
+_EMPTY_HTML = """
+        <div style="text-align: center; padding: 40px;">
+            <p style="color: {color}; font-size: 16px;">{message}</p>{hint}
         </div>
-    </div>
+        """
+_EMPTY_HINT_HTML = """
+            <p style="color: #94a3b8; font-size: 14px;">{hint}</p>"""
+
+@lru_cache(maxsize=4096)
+def _supplier_info(supplier_raw):
+    """(nome a mostrar, é Auto Prudente) - o mesmo supplier repete-se em todos os grupos/durações"""
+    raw = supplier_raw or ''
+    name = display_supplier_name(supplier_raw)
+    is_ap = 'auto prudente' in name.lower() or 'autoprudente' in raw.lower() or raw.upper() == 'AUP'
+    return name, is_ap
+
+# (fundo, texto, troféu) por posição da Auto Prudente no grupo
+_POSITION_STYLES = {1: (COLOR_PRIMARY, True), 2: (COLOR_ORANGE, True), 3: (COLOR_YELLOW, True)}
+
+def _group_view(name, cars, lowest):
+    """Um grupo (dias × grupo): posição AP + top 5, tudo já formatado para os fragmentos HTML"""
+    ranked = sorted(cars, key=lambda pc: pc[0])
+    ap_position = None
+    for idx, (_, car) in enumerate(ranked, 1):
+        if _supplier_info(car.get('supplier', '') or '')[1]:
+            ap_position = idx
+            break
+
+    if ap_position in _POSITION_STYLES:
+        position_bg, trophy = _POSITION_STYLES[ap_position]
+    elif ap_position and ap_position <= 5:
+        position_bg, trophy = COLOR_GRAY, False
+    elif ap_position:
+        position_bg, trophy = COLOR_RED, False
+    else:
+        position_bg, trophy = COLOR_GRAY, False
+
+    competitors = []
+    for idx, (_, car) in enumerate(ranked[:5], 1):
+        supplier, is_ap = _supplier_info(car.get('supplier', 'Unknown'))
+        price = float(car.get('price_num', 0))
+        car_name = car.get('car', 'Unknown')
+        competitors.append({
+            'idx': idx,
+            'supplier': supplier,
+            'is_ap': is_ap,
+            'name': car_name,
+            # PRIORITY: vehicle_images DB, then CarJet CDN
+            'photo': fix_photo_url_for_email(car.get('photo', ''), car_name=car_name),
+            'price': f"{price:.2f}",
+            'is_lowest': abs(price - lowest) < 0.01,
+        })
+
+    return {
+        'name': name,
+        'ap_position': ap_position,
+        'position_bg': position_bg,
+        'text_color': "#92400e" if position_bg == COLOR_YELLOW else "#fff",
+        'position_text': f"{ap_position}º" if ap_position else "N/A",
+        'trophy': trophy,
+        'competitors': competitors,
+    }
+
+def _aggregate_location(results):
+    """Uma passagem pelos resultados de uma localização -> secções por dias + stats
+
+    Igual para diário e semanal (o semanal só acrescenta a barra do mês) e para
+    todas as línguas, por isso render_reports_batch calcula-o uma vez por localização.
     """
-    
-    html += stats_html + content_html + generate_report_footer()
+    by_days = {}
+    lowest_per_day = {}
+    for car in results:
+        days = car.get('days', 1)
+        price = float(car.get('price_num', 999999))
+        by_days.setdefault(days, {}).setdefault(car.get('group', 'Unknown'), []).append((price, car))
+        # Lowest price PER DAY (not global)
+        if price < lowest_per_day.get(days, float('inf')):
+            lowest_per_day[days] = price
+
+    sections = []
+    best = competitive = total = 0
+    for days in sorted(by_days):
+        groups = []
+        for group in sorted(by_days[days]):
+            view = _group_view(group, by_days[days][group], lowest_per_day[days])
+            total += 1
+            if view['ap_position'] == 1:
+                best += 1
+            elif view['ap_position'] in (2, 3):
+                competitive += 1
+            groups.append(view)
+        sections.append({'days': days, 'groups': groups})
+
+    percentage = (best / total * 100) if total > 0 else 0
+    return {
+        'sections': sections,
+        'stats': {'best': best, 'competitive': competitive, 'percentage': f"{percentage:.0f}"},
+    }
+
+def _results_by_location(search_data):
+    """Resultados agrupados por localização (minúsculas) numa só passagem"""
+    by_location = {}
+    for r in (search_data or {}).get('results') or []:
+        by_location.setdefault(r.get('location', '').lower(), []).append(r)
+    return by_location
+
+def _report_title(kind, location, labels, now):
+    if kind == 'weekly':
+        return f"{labels['weekly_title']} - {location}", f"{labels['week']} {now.strftime('%W/%Y')}"
+    return f"{labels['daily_title']} - {location}", now.strftime(labels['date_format'])
+
+def _group_html(view, lang):
+    """HTML de um cartão de grupo; guardado na view por língua (diário e semanal reutilizam)"""
+    cache = view.setdefault('html', {})
+    if lang in cache:
+        return cache[lang]
+    badge = _BEST_BADGE_HTML.format(label=_labels(lang)['best_badge'])
+    parts = [_GROUP_OPEN_HTML.format(
+        name=escape(view['name']),
+        position_bg=view['position_bg'],
+        text_color=view['text_color'],
+        position_icon=ICON_TROPHY if view['trophy'] else '',
+        position_text=view['position_text'],
+    )]
+    for c in view['competitors']:
+        name = escape(c['name'])
+        if c['photo']:
+            visual = _PHOTO_HTML.format(src=escape(c['photo']), alt=name)
+        else:
+            # Fallback: ícone SVG pequeno
+            visual = ICON_CAR
+        parts.append(_COMPETITOR_HTML.format(
+            css='autoprudente' if c['is_ap'] else '',
+            visual=visual,
+            weight='bold' if c['is_ap'] else '600',
+            color='#009cb6' if c['is_ap'] else '#1e293b',
+            idx=c['idx'],
+            supplier=escape(c['supplier']),
+            name=name,
+            price=c['price'],
+            badge=badge if c['is_lowest'] else '',
+        ))
+    parts.append(_GROUP_CLOSE_HTML)
+    cache[lang] = html = ''.join(parts)
     return html
 
-def generate_weekly_report_html_by_location(search_data, location):
+def _render_report(kind, location, aggregate, lang, has_data=True, now=None):
+    now = now or datetime.now()
+    labels = _labels(lang)
+    title, subtitle = _report_title(kind, location, labels, now)
+    parts = [generate_report_header(title, subtitle)]
+    if aggregate is None:
+        if has_data:
+            parts.append(_EMPTY_HTML.format(
+                color=COLOR_GRAY, message=escape(labels['no_location_data'].format(location=location)), hint=''))
+        else:
+            hint = _EMPTY_HINT_HTML.format(hint=labels['no_data_hint']) if kind == 'daily' else ''
+            parts.append(_EMPTY_HTML.format(color=COLOR_RED, message=labels['no_data'], hint=hint))
+    else:
+        stats = aggregate['stats']
+        parts.append(_STATS_HTML.format(
+            best=stats['best'], competitive=stats['competitive'], percentage=stats['percentage'],
+            best_label=labels['best_prices'], competitive_label=labels['competitive'],
+            leadership_label=labels['leadership'],
+        ))
+        # Semanal: MÊS → dias → grupos (mês da pesquisa = mês corrente)
+        if kind == 'weekly':
+            parts.append(_MONTH_BAR_HTML.format(month=now.strftime('%B %Y')))
+        day_bar = _DAY_BAR_HTML[kind]
+        for section in aggregate['sections']:
+            days = section['days']
+            parts.append(day_bar.format(days=days, days_label=labels['days'] if days > 1 else labels['day']))
+            parts.extend(_group_html(view, lang) for view in section['groups'])
+    parts.append(_report_footer(now.year, lang))
+    return ''.join(parts)
+
+def render_reports_batch(search_data, locations, kinds=('daily',), languages=('pt',)):
+    """Gera todos os relatórios (localização × tipo × língua) de uma vez
+
+    Os resultados são separados por localização e agregados uma só vez; os
+    cartões de grupo são gerados uma vez por língua e partilhados entre tipos. Devolve {(kind, location, lang): html}.
+    """
+    now = datetime.now()
+    by_location = _results_by_location(search_data)
+    has_data = bool(by_location)
+    reports = {}
+    for location in locations:
+        results = by_location.get(location.lower())
+        aggregate = _aggregate_location(results) if results else None
+        for kind in kinds:
+            for lang in languages:
+                reports[(kind, location, lang)] = _render_report(kind, location, aggregate, lang, has_data, now)
+    return reports
+
+def generate_daily_report_html_by_location(search_data, location, lang='pt'):
+    """
+    Generate visual HTML report for ONE location only
+    Shows ALL selected days from settings
+    ORGANIZED BY DAYS FIRST (1 day → all groups, 2 days → all groups, etc)
+    """
+    return render_reports_batch(search_data, [location], ('daily',), (lang,))[('daily', location, lang)]
+
+def generate_weekly_report_html_by_location(search_data, location, lang='pt'):
     """
     Relatório SEMANAL - Estrutura: MÊS → dias → grupos
     Igual ao diário mas com um nível extra (mês)
     """
-    # SVG Icons
-    icon_car = '<svg width="18" height="18" fill="currentColor" viewBox="0 0 24 24"><path d="M18.92 6.01C18.72 5.42 18.16 5 17.5 5h-11c-.66 0-1.21.42-1.42 1.01L3 12v8c0 .55.45 1 1 1h1c.55 0 1-.45 1-1v-1h12v1c0 .55.45 1 1 1h1c.55 0 1-.45 1-1v-8l-2.08-5.99zM6.5 16c-.83 0-1.5-.67-1.5-1.5S5.67 13 6.5 13s1.5.67 1.5 1.5S7.33 16 6.5 16zm11 0c-.83 0-1.5-.67-1.5-1.5s.67-1.5 1.5-1.5 1.5.67 1.5 1.5-.67 1.5-1.5 1.5zM5 11l1.5-4.5h11L19 11H5z"/></svg>'
-    icon_trophy = '<svg width="18" height="18" fill="currentColor" viewBox="0 0 24 24"><path d="M20 7h-2V5c0-1.1-.9-2-2-2H8c-1.1 0-2 .9-2 2v2H4c-1.1 0-2 .9-2 2v3c0 2.5 1.5 4.7 3.8 5.7.5 1.7 1.8 3 3.5 3.7V23h5v-1.6c1.7-.7 3-2 3.5-3.7 2.3-1 3.8-3.2 3.8-5.7V9c0-1.1-.9-2-2-2zm0 5c0 1.9-1.2 3.5-2.9 4.1-.2-1.3-.8-2.4-1.7-3.3l-1.4 1.4c.6.6 1 1.5 1 2.4 0 1.9-1.6 3.5-3.5 3.5S8 18.5 8 16.6c0-.9.4-1.8 1-2.4L7.6 12.8c-.9.9-1.5 2-1.7 3.3C4.2 15.5 3 13.9 3 12V9h3V5h12v4h3v3z"/></svg>'
-    icon_calendar = '<svg width="16" height="16" fill="currentColor" viewBox="0 0 24 24"><path d="M19 4h-1V2h-2v2H8V2H6v2H5c-1.1 0-2 .9-2 2v14c0 1.1.9 2 2 2h14c1.1 0 2-.9 2-2V6c0-1.1-.9-2-2-2zm0 16H5V10h14v10zM5 8V6h14v2H5z"/></svg>'
-    
-    if not search_data or not search_data.get('results'):
-        html = generate_report_header(
-            f"Relatório Semanal - {location}",
-            f"Semana {datetime.now().strftime('%W/%Y')}"
-        )
-        html += """
-        <div style="text-align: center; padding: 40px;">
-            <p style="color: #ef4444; font-size: 16px;">Sem dados de pesquisa disponíveis</p>
-        </div>
-        """
-        html += generate_report_footer()
-        return html
-    
-    # Filter by location
-    results = [r for r in search_data['results'] if r.get('location', '').lower() == location.lower()]
-    
-    if not results:
-        html = generate_report_header(
-            f"Relatório Semanal - {location}",
-            f"Semana {datetime.now().strftime('%W/%Y')}"
-        )
-        html += f"""
-        <div style="text-align: center; padding: 40px;">
-            <p style="color: #94a3b8; font-size: 16px;">Sem dados para {location}</p>
-        </div>
-        """
-        html += generate_report_footer()
-        return html
-    
-    # Group by MONTH first, then by DAYS, then by GROUP
-    # Estrutura: MÊS → dias → grupos (igual ao diário mas com mês no topo)
-    from collections import defaultdict
-    from datetime import datetime as dt
-    
-    data_by_month = defaultdict(lambda: defaultdict(dict))
-    
-    for car in results:
-        days = car.get('days', 1)
-        group = car.get('group', 'Unknown')
-        
-        # Determinar mês (assumir pesquisa para próximo mês para simplificar)
-        month_key = datetime.now().strftime('%B %Y')
-        
-        if days not in data_by_month[month_key]:
-            data_by_month[month_key][days] = {}
-        
-        if group not in data_by_month[month_key][days]:
-            data_by_month[month_key][days][group] = []
-        
-        data_by_month[month_key][days][group].append(car)
-    
-    # Find the lowest price PER DAY (not global)
-    lowest_price_per_day = {}
-    for month, days_data in data_by_month.items():
-        for days, groups in days_data.items():
-            all_prices_for_day = []
-            for group, cars in groups.items():
-                for car in cars:
-                    all_prices_for_day.append(float(car.get('price_num', 999999)))
-            lowest_price_per_day[days] = min(all_prices_for_day) if all_prices_for_day else 999999
-    
-    # Stats
-    ap_best_price = 0
-    ap_competitive = 0
-    total_searches = 0
-    
-    # Generate HTML
-    html = generate_report_header(
-        f"Relatório Semanal - {location}",
-        f"Semana {datetime.now().strftime('%W/%Y')}"
-    )
-    
-    content_html = ""
-    
-    # Iterar por meses
-    for month in sorted(data_by_month.keys()):
-        days_data = data_by_month[month]
-        
-        # BARRA AZUL GRANDE - Mês
-        content_html += f"""
-        <div style="background: {COLOR_PRIMARY}; padding: 20px 20px; margin: 30px 0 20px 0; border-radius: 6px;">
-            <div style="color: #fff; font-size: 22px; font-weight: bold; display: flex; align-items: center; gap: 8px;">
-                {icon_calendar} {month}
-            </div>
-        </div>
-        """
-        
-        # Dentro do mês: dias → grupos (igual ao diário)
-        sorted_days = sorted(days_data.keys())
-        
-        for days in sorted_days:
-            groups = days_data[days]
-            
-            # BARRA AZUL média - Dias
-            content_html += f"""
-            <div style="background: {COLOR_PRIMARY}; padding: 15px 20px; margin: 25px 0 15px 0; border-radius: 6px; opacity: 0.9;">
-                <div style="color: #fff; font-size: 18px; font-weight: bold; display: flex; align-items: center; gap: 8px;">
-                    {icon_calendar} {days} dia{'s' if days > 1 else ''}
-                </div>
-            </div>
-            """
-            
-            # Grupos
-            for group in sorted(groups.keys()):
-                cars = groups[group]
-                total_searches += 1
-                
-                sorted_cars = sorted(cars, key=lambda x: float(x.get('price_num', 999999)))
-                
-                # Find AP position
-                ap_position = None
-                for idx, car in enumerate(sorted_cars, 1):
-                    supplier_raw = (car.get('supplier', '') or '')
-                    supplier_name = display_supplier_name(supplier_raw).lower()
-                    if 'auto prudente' in supplier_name or 'autoprudente' in supplier_raw.lower() or supplier_raw.upper() == 'AUP':
-                        ap_position = idx
-                        break
-                
-                if ap_position == 1:
-                    ap_best_price += 1
-                    position_bg = COLOR_PRIMARY
-                    position_text = "1º"
-                    position_icon = icon_trophy
-                elif ap_position == 2:
-                    ap_competitive += 1
-                    position_bg = COLOR_ORANGE
-                    position_text = "2º"
-                    position_icon = icon_trophy
-                elif ap_position == 3:
-                    ap_competitive += 1
-                    position_bg = COLOR_YELLOW
-                    position_text = "3º"
-                    position_icon = icon_trophy
-                elif ap_position and ap_position <= 5:
-                    position_bg = COLOR_GRAY
-                    position_text = f"{ap_position}º"
-                    position_icon = ""
-                elif ap_position:
-                    position_bg = COLOR_RED
-                    position_text = f"{ap_position}º"
-                    position_icon = ""
-                else:
-                    position_bg = COLOR_GRAY
-                    position_text = "N/A"
-                    position_icon = ""
-                
-                text_color = "#fff" if position_bg not in [COLOR_YELLOW] else "#92400e"
-                
-                # BARRA AMARELA - Grupo
-                content_html += f"""
-                <div style="background: {COLOR_YELLOW}; height: 3px; margin: 15px 0 15px 0;"></div>
-                """
-                
-                # Group card
-                content_html += f"""
-                <div class="group-card">
-                    <div class="group-header">
-                        <div style="display: flex; align-items: center; gap: 10px;">
-                            {icon_car}
-                            <span class="group-name">{group}</span>
-                        </div>
-                        <div style="display: flex; align-items: center; gap: 8px; background: {position_bg}; color: {text_color}; padding: 8px 16px; border-radius: 6px; font-size: 14px; font-weight: 600; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
-                            {position_icon}
-                            <span>{position_text}</span>
-                        </div>
-                    </div>
-                    <div class="price-comparison">
-                """
-                
-                # Top 5 competitors
-                for idx, car in enumerate(sorted_cars[:5], 1):
-                    supplier_raw = car.get('supplier', 'Unknown')
-                    supplier = display_supplier_name(supplier_raw)  # Traduzir código para nome real
-                    price = float(car.get('price_num', 0))
-                    is_ap = 'auto prudente' in supplier.lower() or 'autoprudente' in supplier_raw.lower()
-                    
-                    car_photo = car.get('photo', '')
-                    car_name = car.get('car', 'Unknown')
-                    
-                    # Fix photo URL for email - PRIORITY: vehicle_images DB, then CarJet CDN
-                    # Pass car_name to lookup in vehicle_images table
-                    fixed_photo = fix_photo_url_for_email(car_photo, car_name=car_name)
-                    
-                    if fixed_photo:
-                        car_visual = f'<img src="{fixed_photo}" alt="{car_name}" style="width: 85px; max-height: 60px; object-fit: contain; border-radius: 8px; box-shadow: 0 2px 6px rgba(0,0,0,0.15);">'
-                    else:
-                        car_visual = icon_car
-                    
-                    # Check if this is the lowest price FOR THIS DAY
-                    is_lowest = abs(price - lowest_price_per_day[days]) < 0.01
-                    
-                    # Badge for lowest price - below price
-                    price_badge = ''
-                    if is_lowest:
-                        price_badge = '<div style="margin-top: 4px;"><span style="display: inline-block; background: #f4ad0f; color: #fff; padding: 3px 8px; border-radius: 4px; font-size: 10px; font-weight: bold;">MELHOR</span></div>'
-                    
-                    content_html += f"""
-                    <div class="competitor {'autoprudente' if is_ap else ''}">
-                        <!-- Foto à esquerda -->
-                        <div style="flex-shrink: 0; width: 90px; display: flex; align-items: flex-start; justify-content: center;">
-                            {car_visual}
-                        </div>
-                        
-                        <!-- Info do supplier e carro (grow) -->
-                        <div style="flex: 1; min-width: 0;">
-                            <div style="font-weight: {'bold' if is_ap else '600'}; color: {'#009cb6' if is_ap else '#1e293b'}; font-size: 13px; margin-bottom: 4px; line-height: 1.4;">
-                                {idx}. {supplier}
-                            </div>
-                            <div style="font-size: 12px; color: #64748b; line-height: 1.4;">
-                                {car_name}
-                            </div>
-                        </div>
-                        
-                        <!-- Preço centralizado verticalmente -->
-                        <div style="flex-shrink: 0; display: flex; flex-direction: column; align-items: center; justify-content: center; min-width: 100px;">
-                            <div style="font-size: 14px; font-weight: bold; color: {'#009cb6' if is_ap else '#1e293b'}; white-space: nowrap; text-align: center;">
-                                {price:.2f}€
-                            </div>
-                            {price_badge}
-                        </div>
-                    </div>
-                    """
-                
-                content_html += """
-                    </div>
-                </div>
-                """
-    
-    # Stats
-    ap_percentage = (ap_best_price / total_searches * 100) if total_searches > 0 else 0
-    
-    stats_html = f"""
-    <div class="stats-box">
-        <div class="stat">
-            <div class="stat-value" style="color: {COLOR_PRIMARY};">{ap_best_price}</div>
-            <div class="stat-label">Melhores Preços</div>
-        </div>
-        <div class="stat">
-            <div class="stat-value" style="color: #92400e;">{ap_competitive}</div>
-            <div class="stat-label">Competitivos</div>
-        </div>
-        <div class="stat">
-            <div class="stat-value">{ap_percentage:.0f}%</div>
-            <div class="stat-label">Taxa de Liderança</div>
-        </div>
-    </div>
-    """
-    
-    html += stats_html + content_html + generate_report_footer()
-    return html
+    return render_reports_batch(search_data, [location], ('weekly',), (lang,))[('weekly', location, lang)]
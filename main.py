@@ -456,6 +456,8 @@ def scrape_with_playwright(url: str) -> List[Dict[str, Any]]:
 
 import os
 import sys
+import atexit
+import threading
 import secrets
 import re
 from urllib.parse import urljoin
@@ -464,6 +466,8 @@ import asyncio
 from datetime import datetime, timezone, timedelta
 import traceback as _tb
 import logging
+from collections import OrderedDict, deque
+from functools import lru_cache, partial
 import json
 import base64
 
@@ -503,6 +507,7 @@ except Exception as e:
     logging.error(f"❌ Failed to initialize Sentry: {e}")
 from urllib.parse import urlencode, quote_plus
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemLoader
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from starlette.status import HTTP_303_SEE_OTHER
@@ -516,11 +521,20 @@ import asyncio
 from bs4 import BeautifulSoup
 import sqlite3
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 import random
 
 # Import database module for PostgreSQL/SQLite hybrid support
 try:
     from database import _db_connect as _db_connect_new, USE_POSTGRES, PostgreSQLConnectionWrapper as DBPostgreSQLWrapper
+    from database import DBGate, run_db as _run_db, get_pool_stats as _get_db_pool_stats
+    from database import get_query_cache_stats as _get_db_query_cache_stats
+    from database import price_snapshot_rows as _price_snapshot_rows
+    from database import bulk_insert_price_snapshots as _bulk_insert_price_snapshots
+    from database import get_ingest_stats as _get_db_ingest_stats
+    from database import bulk_insert_rows as _bulk_insert_rows
+    from database import listen_connection as _db_listen_connection
+    from database import ensure_price_rollup_table, backfill_price_rollup
     _USE_NEW_DB = True
     # Usar a classe do database.py em vez da local
     PostgreSQLConnectionWrapper = DBPostgreSQLWrapper
@@ -530,10 +544,25 @@ try:
         logging.info("📁 SQLite mode (local development)")
 except ImportError:
     _USE_NEW_DB = False
+    DBGate = None
+    _get_db_pool_stats = None
+    _get_db_query_cache_stats = None
+    _price_snapshot_rows = None
+    _bulk_insert_price_snapshots = None
+    _bulk_insert_rows = None
+    _db_listen_connection = None
+    _get_db_ingest_stats = None
+    ensure_price_rollup_table = None
+    backfill_price_rollup = None
     logging.info("📁 Using legacy SQLite connection")
+
+    async def _run_db(fn, *args, **kwargs):
+        return await asyncio.to_thread(fn, *args, **kwargs)
 import time
 import io
+import bisect
 import hashlib
+import mimetypes
 import smtplib
 from email.message import EmailMessage
 from fastapi import Query
@@ -561,6 +590,22 @@ except ImportError:
     _HAS_CARJET_REQUESTS = False
     scrape_carjet_requests = None
 
+# Thumbnails/WebP/AVIF das fotos (Pillow); sem ele as fotos são servidas como estão
+try:
+    import image_variants
+except ImportError:
+    logging.warning("⚠️  Could not import image_variants (Pillow)")
+    image_variants = None
+
+# PDFs dos Damage Reports (template + coordenadas compilados, batch em processos)
+import damage_report_pdf
+# Campos dos Rental Agreements (coordenadas compiladas, batch em processos)
+import ra_extractor
+# Jobs em background das operações longas de admin (scraping, fotos, backups)
+import background_jobs
+# Download concorrente/condicional das fotos dos veículos (CDN do CarJet)
+import vehicle_photo_fetch
+
 # Import match helper
 try:
     from match_helper import match_vehicle_group_by_characteristics
@@ -573,6 +618,15 @@ _admin_vehicles_cache = None
 _admin_vehicles_cache_time = 0
 ADMIN_VEHICLES_CACHE_TTL = 300  # 5 minutos
 
+# Classificador de grupos (map_category_to_group): índice do VEHICLES construído uma vez
+# e memo por (category, car_name, transmission). Limpo quando car_groups,
+# vehicle_name_overrides ou o VEHICLES mudam.
+VEHICLE_GROUP_MEMO_MAX = int(os.getenv("VEHICLE_GROUP_MEMO_MAX", "20000"))
+_vehicle_group_memo: Dict[Tuple[str, str, str], str] = {}
+_vehicle_index = None
+_car_group_names: Optional[Dict[str, str]] = None
+_vehicle_classifier_stats = {"hits": 0, "misses": 0, "rebuilds": 0}
+
 # In-memory WhatsApp conversation cache (used by webhook handler)
 whatsapp_conversations: List[Dict[str, Any]] = []
 whatsapp_conversation_counter = 0
@@ -614,6 +668,7 @@ PRICES_CACHE_TTL_SECONDS = int(os.getenv("PRICES_CACHE_TTL_SECONDS", "300") or 3
 BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "6") or 6)
 BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "2") or 2)
 GLOBAL_FETCH_RPS = float(os.getenv("GLOBAL_FETCH_RPS", "5") or 5.0)
+GLOBAL_FETCH_BURST = int(os.getenv("GLOBAL_FETCH_BURST", "1") or 1)
 
 # --- Precompiled regexes for parser performance ---
 AUTO_RX = re.compile(r"\b(auto|automatic|automatico|automático|automatik|aut\.|a/t|at|dsg|cvt|bva|tiptronic|steptronic|s\s*tronic|multidrive|multitronic|eat|eat6|eat8)\b", re.I)
@@ -623,6 +678,168 @@ CAR_CODE_RX = re.compile(r"car_([A-Za-z0-9]+)\.jpg", re.I)
 OBJ_RX = re.compile(r"\{[^{}]*\"priceStr\"\s*:\s*\"[^\"]+\"[^{}]*\"id\"\s*:\s*\"[^\"]+\"[^{}]*\}", re.S)
 DATAMAP_RX = re.compile(r"var\s+dataMap\s*=\s*(\[.*?\]);", re.S)
 
+def _any_rx(patterns, flags: int = 0) -> "re.Pattern[str]":
+    """One alternation regex equivalent to any(re.search(p, s) for p in patterns)"""
+    return re.compile("|".join(f"(?:{p})" for p in patterns), flags)
+
+# Model families used by parse_prices card classification (compiled once)
+BLOCKED_MODEL_RX = _any_rx([
+    r"\bmercedes\s+s\s*class\b", r"\bmercedes\s+cla\b", r"\bmercedes\s+cle\b",
+    r"\bmercedes\s+a\s*class\b", r"\bmercedes\s+c\s*class\b", r"\bmercedes\s+e\s*class\b",
+    r"\bmercedes\s+gla\b", r"\bbmw\s+1\s*series\b", r"\bbmw\s+2\s*series\b",
+    r"\bbmw\s+3\s*series\b", r"\bbmw\s+5\s*series\b", r"\bbmw\s*x1\b",
+    r"\bvolvo\s+v60\b", r"\bvolvo\s+xc40\b", r"\bvolvo\s+xc60\b", r"\bvolvo\s+ex30\b",
+    r"\btesla\s+model\s*3\b", r"\bmg\s+zs\b", r"\bmazda\s+mx5\b", r"\bvolkswagen\s+t-roc\b",
+])
+D_MODELS_RX = _any_rx([
+    r"dacia\s+sandero", r"peugeot\s*208", r"opel\s*corsa", r"seat\s*ibiza", r"seat\s*leon",
+    r"kia\s*ceed", r"(vw|volkswagen)\s*polo", r"renault\s*clio", r"ford\s*fiesta",
+    r"ford\s*focus", r"hyundai\s*i20", r"nissan\s*micra", r"audi\s*a1",
+])
+D_MODELS_FINAL_RX = _any_rx([
+    r"\bpeugeot\s*208\b", r"\bopel\s*corsa\b", r"\bseat\s*ibiza\b", r"\bseat\s*leon\b",
+    r"\bkia\s*ceed\b", r"\b(vw|volkswagen)\s*polo\b", r"\bcitro[eë]n\s*c3\b",
+    r"\brenault\s*clio\b", r"\bford\s*fiesta\b", r"\bford\s*focus\b", r"\bnissan\s*micra\b",
+    r"\bhyundai\s*i20\b", r"\baudi\s*a1\b", r"\bdacia\s*sandero\b",
+])
+D_FAMILY_RX = _any_rx([
+    r"\bpeugeot\s*208\b", r"\bopel\s*corsa\b", r"\bseat\s*ibiza\b",
+    r"\bseat\s*leon\b", r"\b(vw|volkswagen)\s*golf\b", r"\b(vw|volkswagen)\s*polo\b",
+    r"\brenault\s*clio\b", r"\bford\s*fiesta\b", r"\bnissan\s*micra\b",
+    r"\bhyundai\s*i20\b", r"\baudi\s*a1\b", r"\bdacia\s*sandero\b", r"\brenault\s*megane\b",
+])
+N_VAN_RX = _any_rx([
+    r"\bmercedes\s*vito\b", r"\bmercedes\s*v[-\s]?class\b", r"\bford\s*transit\b",
+    r"\bford\s*tourneo\b", r"\brenault\s*trafic\b", r"\bpeugeot\s*traveller\b",
+    r"\bcitro[eë]n\s*spacetourer\b", r"\btoyota\s*proace\b", r"\bopel\s*vivaro\b",
+    r"\bfiat\s*talento\b",
+])
+M2_MODELS_RX = _any_rx([
+    r"\bcitro[eë]n\s*c4\s*(picasso|grand\s*spacetourer|grand\s*space\s*tourer)\b",
+    r"\bcitro[eë]n\s*grand\s*picasso\b", r"\brenault\s*grand\s*sc[eé]nic\b",
+    r"\bmercedes\s*glb\b.*\b(7\s*seater|7\s*lugares|7p|7\s*seats)\b",
+    r"\b(vw|volkswagen)\s*multivan\b", r"\b(vw|volkswagen)\s*caddy\b",
+    r"\b(vw|volkswagen)\s*sharan\b", r"\bseat\s*alhambra\b", r"\bford\s*galaxy\b",
+    r"\bpeugeot\s*rifter\b", r"\bpeugeot\s*5008\b", r"\bdacia\s*jogger\b", r"\bopel\s*zafira\b",
+])
+E1_MODELS_RX = _any_rx([
+    r"\btoyota\s*aygo\b", r"\bkia\s*picanto\b", r"\bfiat\s*panda\b", r"\bhyundai\s*i10\b",
+    r"\bfiat\s*500\b", r"\bpeugeot\s*108\b", r"\bcitro[eë]n\s*c1\b", r"\b(vw|volkswagen)\s*up\b",
+])
+B1_MODELS_RX = _any_rx([
+    r"\bfiat\s*500\b", r"\bcitro[eë]n\s*c1\b", r"\bpeugeot\s*108\b", r"\bopel\s*adam\b",
+    r"\btoyota\s*aygo\b", r"\b(vw|volkswagen)\s*up\b", r"\bford\s*ka\b",
+    r"\brenault\s*twingo\b", r"\bkia\s*picanto\b",
+])
+B1_D_GUARD_RX = _any_rx([
+    r"\bpeugeot\s*208\b", r"\bopel\s*corsa\b", r"\bseat\s*ibiza\b",
+    r"\b(vw|volkswagen)\s*polo\b", r"\bcitro[eë]n\s*c3\b", r"\brenault\s*clio\b",
+    r"\bford\s*fiesta\b", r"\bnissan\s*micra\b", r"\bhyundai\s*i20\b", r"\baudi\s*a1\b",
+    r"\bdacia\s*sandero\b",
+])
+PRICE_TEXT_RX = re.compile(r"(?:€\s*\d{1,4}(?:[\.,]\d{3})*(?:[\.,]\d{2})?|\bEUR\s*\d{1,4}(?:[\.,]\d{3})*(?:[\.,]\d{2})?)", re.I)
+
+# CSS equivalent of _is_result_card (used by benchmark_parse_prices.py --check)
+RESULT_CARD_SELECTOR = "section.newcarlist article, .newcarlist article, article.car, li.result, li.car, .car-item, .result-row"
+
+def _is_result_card(tag) -> bool:
+    """Tag predicate matching RESULT_CARD_SELECTOR without going through soupsieve"""
+    classes = tag.get("class") or ()
+    if "car-item" in classes or "result-row" in classes:
+        return True
+    name = tag.name
+    if name == "li":
+        return "result" in classes or "car" in classes
+    if name == "article":
+        if "car" in classes:
+            return True
+        for parent in tag.parents:
+            if "newcarlist" in (parent.get("class") or ()):
+                return True
+    return False
+
+def _scan_result_page(soup) -> Tuple[Any, Any, list]:
+    """Single walk over the tree returning (checked frmTrans input, #filterUsed, result cards)
+
+    Equivalent to the select_one/select calls it replaces, in document order.
+    """
+    from bs4.element import Tag
+    trans_input = None
+    filter_used = None
+    cards = []
+    for el in soup.descendants:
+        if not isinstance(el, Tag):
+            continue
+        if trans_input is None and el.name == "input" and el.get("name") == "frmTrans" and el.has_attr("checked"):
+            trans_input = el
+        if filter_used is None and el.get("id") == "filterUsed":
+            filter_used = el
+        if _is_result_card(el):
+            cards.append(el)
+    return trans_input, filter_used, cards
+
+def _find_price_strings(soup) -> list:
+    """Same nodes as soup.find_all(text=PRICE_TEXT_RX), without the SoupStrainer overhead"""
+    from bs4.element import NavigableString
+    search = PRICE_TEXT_RX.search
+    return [el for el in soup.descendants if isinstance(el, NavigableString) and search(el)]
+
+# CSS equivalents of the per-card lookups in parse_prices/url_from_row (used by benchmark_parse_prices.py --check)
+CARD_FIELD_SELECTORS = {
+    "price": ".price, .amount, [class*='price'], .nfoPriceDest, .nfoPrice, [data-price]",
+    "name": ".veh-name, .vehicle-name, .model, .titleCar, .title, h3, h2, [class*='veh-name'], [class*='vehicle-name'], [class*='model']",
+    "supplier": ".supplier, .vendor, .partner, [class*='supplier'], [class*='vendor']",
+    "car_img": "img.cl--car-img",
+    "trans_auto": "i.icon-transm-auto, i.icon.icon-transm-auto",
+    "trans": "i.icon-transm",
+    "category": ".category, .group, .vehicle-category, [class*='category'], [class*='group'], [class*='categoria'], [class*='grupo']",
+    "href": "a[href]",
+    "data-href": "*[data-href]",
+    "data-url": "*[data-url]",
+    "data-link": "*[data-link]",
+    "onclick": "*[onclick]",
+}
+
+# Tag predicates for CARD_FIELD_SELECTORS: (tag, class list, class attribute as text) -> bool
+_CARD_FIELD_TESTS = {
+    "price": lambda el, cl, cs: "price" in cs or "amount" in cl or "nfoPriceDest" in cl or "nfoPrice" in cl or el.has_attr("data-price"),
+    "name": lambda el, cl, cs: el.name in ("h2", "h3") or "titleCar" in cl or "title" in cl or "veh-name" in cs or "vehicle-name" in cs or "model" in cs,
+    "supplier": lambda el, cl, cs: "partner" in cl or "supplier" in cs or "vendor" in cs,
+    "car_img": lambda el, cl, cs: el.name == "img" and "cl--car-img" in cl,
+    "trans_auto": lambda el, cl, cs: el.name == "i" and "icon-transm-auto" in cl,
+    "trans": lambda el, cl, cs: el.name == "i" and "icon-transm" in cl,
+    "category": lambda el, cl, cs: "category" in cs or "group" in cs or "categoria" in cs or "grupo" in cs,
+    "href": lambda el, cl, cs: el.name == "a" and el.has_attr("href"),
+    "data-href": lambda el, cl, cs: el.has_attr("data-href"),
+    "data-url": lambda el, cl, cs: el.has_attr("data-url"),
+    "data-link": lambda el, cl, cs: el.has_attr("data-link"),
+    "onclick": lambda el, cl, cs: el.has_attr("onclick"),
+}
+
+def _scan_card(card, keys=None) -> Dict[str, Any]:
+    """Single walk over a card returning the first descendant for each CARD_FIELD_SELECTORS key (or None)
+
+    Same node card.select_one(CARD_FIELD_SELECTORS[key]) would return, without one soupsieve pass per key.
+    """
+    from bs4.element import Tag
+    pending = [(key, _CARD_FIELD_TESTS[key]) for key in (keys or _CARD_FIELD_TESTS)]
+    found = dict.fromkeys(key for key, _ in pending)
+    for el in card.descendants:
+        if not isinstance(el, Tag):
+            continue
+        classes = el.get("class") or ()
+        if isinstance(classes, str):
+            classes = classes.split()
+        joined = " ".join(classes)
+        hits = [item for item in pending if item[1](el, classes, joined)]
+        if hits:
+            for key, _ in hits:
+                found[key] = el
+            pending = [item for item in pending if item not in hits]
+            if not pending:
+                break
+    return found
+
 # Aumentar limite de payload para permitir dados completos (284 carros × ~2KB = ~568KB)
 app = FastAPI(
     title="Rental Price Tracker",
@@ -1142,7 +1359,15 @@ async def unhandled_exception_handler(request: Request, exc: Exception):
     return JSONResponse({"ok": False, "error": "Server error"}, status_code=500)
 
 # --- Prices response cache (memory) ---
-_PRICES_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+# LRU bounded by the approximate JSON size of the cached payloads. Entries
+# past PRICES_CACHE_TTL_SECONDS are still served for PRICES_CACHE_STALE_SECONDS
+# while a single background refresh replaces them.
+PRICES_CACHE_MAX_BYTES = int(os.getenv("PRICES_CACHE_MAX_BYTES", str(64 * 1024 * 1024)) or 64 * 1024 * 1024)
+PRICES_CACHE_STALE_SECONDS = int(os.getenv("PRICES_CACHE_STALE_SECONDS", "3600") or 3600)
+_PRICES_CACHE: "OrderedDict[str, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+_PRICES_CACHE_BYTES = 0
+_PRICES_CACHE_STATS = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0, "deduped": 0}
+_PRICES_INFLIGHT: Dict[str, "asyncio.Future"] = {}
 
 async def _compute_prices_for(url: str) -> Dict[str, Any]:
     headers = {"User-Agent": "Mozilla/5.0 (compatible; PriceTracker/1.0)"}
@@ -1168,31 +1393,93 @@ async def _compute_prices_for(url: str) -> Dict[str, Any]:
         pass
     return {"ok": True, "count": len(items), "items": items}
 
-def _cache_get(url: str) -> Optional[Dict[str, Any]]:
+def _payload_size(payload: Dict[str, Any]) -> int:
     try:
-        ts, payload = _PRICES_CACHE.get(url, (0.0, None))
-        if not payload:
-            return None
+        return len(json.dumps(payload, default=str, separators=(",", ":")))
+    except Exception:
+        return 0
+
+def _cache_lookup(url: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """Return (payload, is_stale); payload is None on a miss or when too old to serve"""
+    try:
+        entry = _PRICES_CACHE.get(url)
+        if not entry:
+            _PRICES_CACHE_STATS["misses"] += 1
+            return None, False
+        ts, payload, _size = entry
         age = time.time() - ts
+        if age > PRICES_CACHE_TTL_SECONDS + PRICES_CACHE_STALE_SECONDS:
+            _cache_invalidate(url)
+            _PRICES_CACHE_STATS["misses"] += 1
+            return None, False
+        _PRICES_CACHE.move_to_end(url)
         if age <= PRICES_CACHE_TTL_SECONDS:
-            return payload
-        return None
+            _PRICES_CACHE_STATS["hits"] += 1
+            return payload, False
+        _PRICES_CACHE_STATS["stale_hits"] += 1
+        return payload, True
     except Exception:
-        return None
+        return None, False
+
+def _cache_get(url: str) -> Optional[Dict[str, Any]]:
+    payload, stale = _cache_lookup(url)
+    return None if stale else payload
 
 def _cache_set(url: str, payload: Dict[str, Any]):
+    global _PRICES_CACHE_BYTES
     try:
-        _PRICES_CACHE[url] = (time.time(), payload)
+        size = _payload_size(payload)
+        if size > PRICES_CACHE_MAX_BYTES:
+            return
+        _cache_invalidate(url)
+        _PRICES_CACHE[url] = (time.time(), payload, size)
+        _PRICES_CACHE_BYTES += size
+        while _PRICES_CACHE_BYTES > PRICES_CACHE_MAX_BYTES and _PRICES_CACHE:
+            _old_url, (_ts, _payload, old_size) = _PRICES_CACHE.popitem(last=False)
+            _PRICES_CACHE_BYTES -= old_size
+            _PRICES_CACHE_STATS["evictions"] += 1
     except Exception:
         pass
 
+def _cache_invalidate(url: str):
+    global _PRICES_CACHE_BYTES
+    entry = _PRICES_CACHE.pop(url, None)
+    if entry:
+        _PRICES_CACHE_BYTES -= entry[2]
+
+def _prices_cache_stats() -> Dict[str, Any]:
+    return {
+        **_PRICES_CACHE_STATS,
+        "entries": len(_PRICES_CACHE),
+        "bytes": _PRICES_CACHE_BYTES,
+        "max_bytes": PRICES_CACHE_MAX_BYTES,
+        "inflight": len(_PRICES_INFLIGHT),
+    }
+
+async def _compute_prices_single_flight(url: str) -> Dict[str, Any]:
+    """Compute prices for url, sharing one upstream fetch between concurrent callers"""
+    fut = _PRICES_INFLIGHT.get(url)
+    if fut is not None:
+        _PRICES_CACHE_STATS["deduped"] += 1
+        return await asyncio.shield(fut)
+    fut = asyncio.ensure_future(_compute_prices_for(url))
+    _PRICES_INFLIGHT[url] = fut
+    try:
+        return await asyncio.shield(fut)
+    finally:
+        if fut.done():
+            _PRICES_INFLIGHT.pop(url, None)
+        else:
+            fut.add_done_callback(lambda _f: _PRICES_INFLIGHT.pop(url, None))
+
 async def _refresh_prices_background(url: str):
+    if url in _PRICES_INFLIGHT:
+        return
     try:
-        data = await _compute_prices_for(url)
+        data = await _compute_prices_single_flight(url)
         _cache_set(url, data)
     except Exception:
         pass
-    return JSONResponse({"ok": False, "error": "Server error"}, status_code=500)
 
 # --- Image cache proxy and retention ---
 def _ext_from_content_type(ct: str) -> str:
@@ -1219,6 +1506,110 @@ def _cache_path_for(url: str) -> Path:
     h = hashlib.sha256(url.encode("utf-8")).hexdigest()
     return CACHE_CARS_DIR / h
 
+# Pool HTTP partilhado para imagens (/img, prefetch, /imglookup): um único AsyncClient
+# por event loop, HTTP/2 quando o pacote h2 existe, limite de ligações por host e
+# single-flight para misses concorrentes do mesmo src
+IMG_MAX_CONNECTIONS = int(os.getenv("IMG_MAX_CONNECTIONS", "32") or 32)
+IMG_MAX_PER_HOST = int(os.getenv("IMG_MAX_PER_HOST", "6") or 6)
+IMG_HTTP_TIMEOUT = float(os.getenv("IMG_HTTP_TIMEOUT", "15") or 15)
+IMG_HEADERS = {"User-Agent": "PriceTracker/1.0"}
+try:
+    import h2  # type: ignore  # noqa: F401  (httpx[http2])
+    _IMG_HTTP2 = True
+except Exception:
+    _IMG_HTTP2 = False
+_IMG_CLIENT: Optional["httpx.AsyncClient"] = None
+_IMG_CLIENT_LOOP = None
+_IMG_HOST_SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+_IMG_INFLIGHT: Dict[str, "asyncio.Future"] = {}
+_IMG_FETCH_STATS = {"fetched": 0, "deduped": 0, "errors": 0, "bytes": 0}
+
+def _get_img_client() -> "httpx.AsyncClient":
+    global _IMG_CLIENT, _IMG_CLIENT_LOOP
+    loop = asyncio.get_running_loop()
+    if _IMG_CLIENT is None or _IMG_CLIENT.is_closed or _IMG_CLIENT_LOOP is not loop:
+        import httpx
+        _IMG_CLIENT = httpx.AsyncClient(
+            http2=_IMG_HTTP2,
+            follow_redirects=True,
+            headers=IMG_HEADERS,
+            timeout=httpx.Timeout(IMG_HTTP_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=IMG_MAX_CONNECTIONS, max_keepalive_connections=IMG_MAX_CONNECTIONS, keepalive_expiry=60.0),
+        )
+        _IMG_CLIENT_LOOP = loop
+        # Semáforos e futures ficam presos ao loop onde foram criados
+        _IMG_HOST_SEMAPHORES.clear()
+        _IMG_INFLIGHT.clear()
+    return _IMG_CLIENT
+
+async def _close_img_client():
+    global _IMG_CLIENT, _IMG_CLIENT_LOOP
+    client, _IMG_CLIENT, _IMG_CLIENT_LOOP = _IMG_CLIENT, None, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+async def _img_request(method: str, url: str, **kwargs) -> "httpx.Response":
+    client = _get_img_client()
+    from urllib.parse import urlparse as _urlparse
+    host = _urlparse(url).netloc.lower()
+    sem = _IMG_HOST_SEMAPHORES.get(host)
+    if sem is None:
+        sem = _IMG_HOST_SEMAPHORES[host] = asyncio.Semaphore(max(1, IMG_MAX_PER_HOST))
+    async with sem:
+        return await client.request(method, url, **kwargs)
+
+def _write_image_cache(key: Path, content: bytes, ct: Optional[str]) -> None:
+    # Escreve para um .tmp e faz replace para que leitores concorrentes nunca vejam um ficheiro parcial
+    tmp = key.with_name(key.name + ".tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, key)
+    if ct:
+        key.with_suffix(".meta").write_text(ct, encoding="utf-8")
+
+async def _download_image(src: str) -> Optional[Tuple[bytes, str]]:
+    try:
+        r = await _img_request("GET", src)
+    except Exception:
+        _IMG_FETCH_STATS["errors"] += 1
+        raise
+    if r.status_code != 200 or not r.content:
+        return None
+    ct = r.headers.get("content-type", "application/octet-stream")
+    _IMG_FETCH_STATS["fetched"] += 1
+    _IMG_FETCH_STATS["bytes"] += len(r.content)
+    try:
+        await asyncio.to_thread(_write_image_cache, _cache_path_for(src), r.content, ct)
+    except Exception:
+        pass
+    return r.content, ct
+
+async def _fetch_image_cached(src: str) -> Optional[Tuple[bytes, str]]:
+    """Descarrega src para CACHE_CARS_DIR; pedidos simultâneos do mesmo src partilham o download"""
+    _get_img_client()
+    fut = _IMG_INFLIGHT.get(src)
+    if fut is not None:
+        _IMG_FETCH_STATS["deduped"] += 1
+        return await asyncio.shield(fut)
+    fut = asyncio.ensure_future(_download_image(src))
+    _IMG_INFLIGHT[src] = fut
+    try:
+        return await asyncio.shield(fut)
+    finally:
+        if fut.done():
+            _IMG_INFLIGHT.pop(src, None)
+        else:
+            fut.add_done_callback(lambda _f: _IMG_INFLIGHT.pop(src, None))
+
+def _img_pool_stats() -> Dict[str, Any]:
+    return {
+        **_IMG_FETCH_STATS,
+        "inflight": len(_IMG_INFLIGHT),
+        "hosts": len(_IMG_HOST_SEMAPHORES),
+        "http2": _IMG_HTTP2,
+        "max_connections": IMG_MAX_CONNECTIONS,
+        "max_per_host": IMG_MAX_PER_HOST,
+    }
+
 def _serve_file(fp: Path, content_type: str = "application/octet-stream"):
     try:
         data = fp.read_bytes()
@@ -1227,11 +1618,134 @@ def _serve_file(fp: Path, content_type: str = "application/octet-stream"):
     headers = {"Cache-Control": f"public, max-age={IMAGE_CACHE_DAYS*86400}"}
     return Response(content=data, media_type=content_type or "application/octet-stream", headers=headers)
 
+# --- Variantes das imagens (?w=largura&format=auto|webp|avif|jpeg|png|original) ---
+# Thumbnails para a grelha de preços e os emails. O Pillow corre num pool de processos
+# (os workers só precisam de image_variants); o resultado fica em disco em
+# CACHE_CARS_DIR como var-<hash da fonte>-<largura>.<formato> e sai com a mesma limpeza
+# por idade das imagens do /img. Sem w/format as respostas são as de sempre.
+IMG_VARIANT_WORKERS = max(1, int(os.getenv("IMG_VARIANT_WORKERS", "2") or 2))
+_IMG_VARIANT_POOL = None
+_IMG_VARIANT_INFLIGHT: Dict[str, "asyncio.Future"] = {}
+_IMG_VARIANT_STATS = {"rendered": 0, "unchanged": 0, "disk_hits": 0, "deduped": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+_IMG_AVIF = bool(image_variants and image_variants.avif_supported())
+
+def _process_pool_context():
+    """Contexto multiprocessing para os pools de processos da app"""
+    import multiprocessing
+    # spawn volta a importar o __main__ em cada worker: com `uvicorn main:app` é só o
+    # uvicorn, mas com `python main.py` seria a app inteira -> aí usa-se fork
+    main_file = getattr(sys.modules.get("__main__"), "__file__", None)
+    same_file = bool(main_file) and os.path.abspath(main_file) == os.path.abspath(__file__)
+    return multiprocessing.get_context("fork" if same_file and os.name == "posix" else "spawn")
+
+def _get_variant_pool():
+    global _IMG_VARIANT_POOL
+    if _IMG_VARIANT_POOL is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _IMG_VARIANT_POOL = ProcessPoolExecutor(max_workers=IMG_VARIANT_WORKERS, mp_context=_process_pool_context())
+    return _IMG_VARIANT_POOL
+
+def _shutdown_variant_pool():
+    global _IMG_VARIANT_POOL
+    pool, _IMG_VARIANT_POOL = _IMG_VARIANT_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+atexit.register(_shutdown_variant_pool)
+
+def _variant_params(width: int, fmt: str) -> Optional[Tuple[Optional[int], str]]:
+    """(largura permitida, formato pedido) ou None = servir o original"""
+    if image_variants is None or (not width and not fmt):
+        return None
+    fmt = (fmt or "original").lower()
+    if fmt not in image_variants.FORMATS:
+        fmt = "original"
+    return image_variants.snap_width(width), fmt
+
+def _variant_etag(source_hash: str, width: Optional[int], fmt: str) -> str:
+    return f'"{source_hash[:32]}-{width or 0}-{fmt}"'
+
+def _read_variant_file(path: Path, same: Path):
+    """bytes da variante, b"" se a variante é o próprio original, None se ainda não existe"""
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        if not same.exists():
+            return None
+        data, path = b"", same
+    try:
+        now = time.time(); os.utime(path, (now, now))
+    except Exception:
+        pass
+    return data
+
+async def _render_variant(key: str, source: bytes, width: Optional[int], fmt: str) -> Optional[Tuple[bytes, str]]:
+    path = CACHE_CARS_DIR / key
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_get_variant_pool(), image_variants.render_variant, source, width, fmt)
+    except Exception as e:
+        _IMG_VARIANT_STATS["errors"] += 1
+        logging.warning(f"[IMG VARIANT] {key}: {type(e).__name__}: {e}")
+        if "BrokenProcessPool" in type(e).__name__:
+            _shutdown_variant_pool()
+        return None
+    try:
+        if result is None:
+            _IMG_VARIANT_STATS["unchanged"] += 1
+            await asyncio.to_thread((CACHE_CARS_DIR / (key + ".same")).write_bytes, b"")
+        else:
+            _IMG_VARIANT_STATS["rendered"] += 1
+            _IMG_VARIANT_STATS["bytes_in"] += len(source)
+            _IMG_VARIANT_STATS["bytes_out"] += len(result[0])
+            await asyncio.to_thread(_write_image_cache, path, result[0], None)
+    except Exception:
+        pass
+    return result
+
+async def _image_variant(source: bytes, source_hash: str, content_type: str, width: Optional[int], fmt: str) -> Tuple[bytes, str]:
+    """(bytes, content_type) da variante; o original quando não há ganho ou em erro"""
+    key = f"var-{source_hash[:32]}-{width or 0}.{fmt}"
+    cached = await asyncio.to_thread(_read_variant_file, CACHE_CARS_DIR / key, CACHE_CARS_DIR / (key + ".same"))
+    if cached is not None:
+        _IMG_VARIANT_STATS["disk_hits"] += 1
+        return (cached, image_variants.CONTENT_TYPES[fmt]) if cached else (source, content_type)
+    fut = _IMG_VARIANT_INFLIGHT.get(key)
+    if fut is not None:
+        _IMG_VARIANT_STATS["deduped"] += 1
+    else:
+        fut = asyncio.ensure_future(_render_variant(key, source, width, fmt))
+        _IMG_VARIANT_INFLIGHT[key] = fut
+        fut.add_done_callback(lambda _f: _IMG_VARIANT_INFLIGHT.pop(key, None))
+    result = await asyncio.shield(fut)
+    return result if result is not None else (source, content_type)
+
+async def _serve_image_variant(request: Request, source: bytes, source_hash: str, content_type: str,
+                               variant: Tuple[Optional[int], str], headers: Dict[str, str]) -> Response:
+    width, requested = variant
+    fmt = image_variants.negotiate(requested, request.headers.get("accept", ""), content_type, _IMG_AVIF)
+    headers = {**headers, "ETag": _variant_etag(source_hash, width, fmt)}
+    if requested == "auto":
+        headers["Vary"] = "Accept"
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    body, media_type = await _image_variant(source, source_hash, content_type, width, fmt)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def _img_variant_stats() -> Dict[str, Any]:
+    return {
+        **_IMG_VARIANT_STATS,
+        "inflight": len(_IMG_VARIANT_INFLIGHT),
+        "workers": IMG_VARIANT_WORKERS,
+        "avif": _IMG_AVIF,
+    }
+
 @app.get("/img")
-async def img_proxy(request: Request, src: str):
+async def img_proxy(request: Request, src: str, w: int = 0, fmt: str = Query("", alias="format")):
     try:
         if not src or not (src.startswith("http://") or src.startswith("https://")):
             raise HTTPException(status_code=400, detail="Invalid src")
+        variant = _variant_params(w, fmt) if request.method != "HEAD" else None
         key = _cache_path_for(src)
         meta = key.with_suffix(".meta")
         # Serve from cache if present
@@ -1247,35 +1761,38 @@ async def img_proxy(request: Request, src: str):
                     ct = (meta.read_text(encoding="utf-8").strip() or ct)
             except Exception:
                 pass
-            return _serve_file(key, ct)
+            if variant is None:
+                return _serve_file(key, ct)
+            try:
+                content = await asyncio.to_thread(key.read_bytes)
+            except Exception:
+                raise HTTPException(status_code=404, detail="Not found")
+            return await _serve_image_variant(request, content, hashlib.sha256(content).hexdigest(), ct, variant,
+                                              {"Cache-Control": f"public, max-age={IMAGE_CACHE_DAYS*86400}"})
 
         # On HEAD requests, don't fetch body, just forward and prime headers
         if request.method == "HEAD":
-            import httpx
-            async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-                hr = await client.head(src)
+            try:
+                hr = await _img_request("HEAD", src)
+            except Exception as e:
+                raise HTTPException(status_code=502, detail=f"Upstream error: {type(e).__name__}")
             if hr.status_code != 200:
                 raise HTTPException(status_code=404, detail="Upstream not found")
             headers = {"Cache-Control": f"public, max-age={IMAGE_CACHE_DAYS*86400}"}
             return Response(status_code=200, headers=headers)
 
-        # Fetch from origin using requests for broader SSL compatibility, then cache
-        import requests as _rq
+        # Fetch from origin through the shared pool (single-flight per src), then cache
         try:
-            rr = _rq.get(src, timeout=15, headers={"User-Agent": "PriceTracker/1.0"})
+            fetched = await _fetch_image_cached(src)
         except Exception as e:
             raise HTTPException(status_code=502, detail=f"Upstream error: {type(e).__name__}")
-        if rr.status_code != 200 or not rr.content:
+        if not fetched:
             raise HTTPException(status_code=404, detail="Upstream not found")
-        ct = rr.headers.get("content-type", "application/octet-stream")
-        try:
-            with key.open("wb") as f:
-                f.write(rr.content)
-            meta.write_text(ct, encoding="utf-8")
-        except Exception:
-            pass
+        content, ct = fetched
         headers = {"Cache-Control": f"public, max-age={IMAGE_CACHE_DAYS*86400}"}
-        return Response(content=rr.content, media_type=ct or "application/octet-stream", headers=headers)
+        if variant is not None:
+            return await _serve_image_variant(request, content, hashlib.sha256(content).hexdigest(), ct, variant, headers)
+        return Response(content=content, media_type=ct or "application/octet-stream", headers=headers)
     except HTTPException:
         raise
     except Exception as e:
@@ -1302,7 +1819,100 @@ def cleanup_image_cache():
 BASE_DIR = Path(__file__).resolve().parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
+# --- Assets do build (build_static_assets.py) ---
+# Os templates grandes têm o JS/CSS inline em bundles static/dist/<nome>.<hash>.js|css
+# (+ .gz/.br); o template sem esses blocos fica em templates/dist.
+STATIC_DIST_DIR = BASE_DIR / "static" / "dist"
+STATIC_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+def _load_built_templates() -> Dict[str, str]:
+    """{template: versão do build} - só para templates que não mudaram desde o build"""
+    built: Dict[str, str] = {}
+    try:
+        manifest = json.loads((STATIC_DIST_DIR / "manifest.json").read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return built
+    except Exception as e:
+        logging.warning(f"[ASSETS] manifest inválido, a servir templates originais: {e}")
+        return built
+    for name, entry in (manifest.get("templates") or {}).items():
+        try:
+            source = (BASE_DIR / "templates" / name).read_bytes()
+            if hashlib.sha256(source).hexdigest() != entry.get("source_sha256"):
+                logging.warning(f"[ASSETS] {name} mudou desde o build - a servir o original (correr build_static_assets.py)")
+                continue
+            assets_ok = all((STATIC_DIST_DIR / url.rsplit("/", 1)[-1]).is_file() for url in entry.get("assets") or [])
+            if assets_ok and (BASE_DIR / "templates" / entry["built"]).is_file():
+                built[name] = entry["built"]
+        except Exception as e:
+            logging.warning(f"[ASSETS] {name}: {e}")
+    return built
+
+BUILT_TEMPLATES = _load_built_templates()
+
+class _BuiltTemplateLoader(FileSystemLoader):
+    """Carrega a versão do build quando existe; o resto dos templates não muda"""
+    def get_source(self, environment, template):
+        return super().get_source(environment, BUILT_TEMPLATES.get(template, template))
+
+templates.env.loader = _BuiltTemplateLoader(str(BASE_DIR / "templates"))
+
+_PAGE_HTML_CACHE: Dict[str, Tuple[float, str]] = {}
+
+def _page_html(name: str) -> str:
+    """Páginas servidas sem Jinja: lidas uma vez (versão do build se existir) até o ficheiro mudar"""
+    path = BASE_DIR / "templates" / BUILT_TEMPLATES.get(name, name)
+    mtime = path.stat().st_mtime
+    cached = _PAGE_HTML_CACHE.get(name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    html = path.read_text(encoding="utf-8")
+    _PAGE_HTML_CACHE[name] = (mtime, html)
+    return html
+
+def _accepted_encodings(scope) -> set:
+    header = dict(scope.get("headers") or []).get(b"accept-encoding", b"").decode("latin-1")
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if token and not re.fullmatch(r"\s*q\s*=\s*0(\.0*)?\s*", params):
+            accepted.add(token.strip().lower())
+    return accepted
+
+class _PrecompressedStaticFiles(StaticFiles):
+    """static/dist: nome com hash -> cache imutável; usa os .br/.gz do build em vez de comprimir por pedido"""
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = None
+        if not path.endswith((".br", ".gz")):
+            accepted = _accepted_encodings(scope)
+            for encoding, suffix in self.ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                full_path, stat_result = await asyncio.to_thread(self.lookup_path, path + suffix)
+                if stat_result is None:
+                    continue
+                response = self.file_response(full_path, stat_result, scope)
+                if response.status_code == 200:
+                    # Content-Encoding já definido -> o GZipMiddleware não volta a comprimir
+                    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                    if media_type.startswith("text/") or media_type.endswith("javascript"):
+                        media_type += "; charset=utf-8"
+                    response.headers["Content-Type"] = media_type
+                    response.headers["Content-Encoding"] = encoding
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = STATIC_IMMUTABLE_CACHE
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
 static_dir = BASE_DIR / "static"
+if STATIC_DIST_DIR.exists():
+    # Antes de /static: o mount mais genérico apanharia /static/dist/...
+    app.mount("/static/dist", _PrecompressedStaticFiles(directory=str(STATIC_DIST_DIR)), name="static_dist")
 if static_dir.exists():
     app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
 # Persistent image cache under DATA_DIR
@@ -1331,16 +1941,7 @@ async def _prefetch_image(url: str):
             except Exception:
                 pass
             return
-        import httpx
-        async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-            r = await client.get(url)
-            if r.status_code != 200 or not r.content:
-                return
-            try:
-                with key.open("wb") as f:
-                    f.write(r.content)
-            except Exception:
-                pass
+        await _fetch_image_cached(url)
     except Exception:
         pass
 
@@ -1379,11 +1980,48 @@ async def static_ap_favicon_redirect():
 DATA_DIR = Path(os.environ.get("DATA_DIR", str(BASE_DIR)))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 DB_PATH = DATA_DIR / "data.db"
-_db_lock = Lock()
+# Serializes SQLite access only; with the PostgreSQL pool callers run concurrently
+_db_lock = DBGate() if DBGate else Lock()
 DEBUG_DIR = Path(os.environ.get("DEBUG_DIR", BASE_DIR / "static" / "debug"))
 DEBUG_DIR.mkdir(parents=True, exist_ok=True)
 
 # --- Admin/Users: DB helpers ---
+# --- SQLite -> PostgreSQL query translation (memoized on the raw SQL) ---
+_PG_INSERT_OR_REPLACE_RX = re.compile(r'INSERT\s+OR\s+REPLACE', re.IGNORECASE)
+_PG_USER_COL_RX = re.compile(r'\buser\b(?=\s*[,\)])', re.IGNORECASE)
+_PG_USER_FIRST_COL_RX = re.compile(r'\(\s*user\s*,', re.IGNORECASE)
+
+@lru_cache(maxsize=int(os.getenv("QUERY_CACHE_SIZE", "512") or 512))
+def _translate_pg_query(query: str) -> str:
+    # Convert SQLite ? placeholders to PostgreSQL %s
+    if '?' in query:
+        query = query.replace('?', '%s')
+    
+    # Convert SQLite AUTOINCREMENT to PostgreSQL SERIAL
+    if 'AUTOINCREMENT' in query.upper():
+        query = query.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
+        query = query.replace('AUTOINCREMENT', '')
+    
+    # Convert SQLite datetime('now') to PostgreSQL NOW()
+    if "datetime('now')" in query or 'datetime("now")' in query:
+        query = query.replace("datetime('now')", "NOW()")
+        query = query.replace('datetime("now")', "NOW()")
+    
+    # Convert INSERT OR REPLACE to INSERT ... ON CONFLICT (automatic PostgreSQL compatibility)
+    if 'INSERT OR REPLACE' in query.upper():
+        # Replace INSERT OR REPLACE with INSERT
+        query = _PG_INSERT_OR_REPLACE_RX.sub('INSERT', query)
+        # Add ON CONFLICT DO NOTHING at the end if not already there
+        if 'ON CONFLICT' not in query.upper():
+            query = query.rstrip().rstrip(';') + ' ON CONFLICT DO NOTHING'
+        logging.debug(f"✅ AUTO-CONVERTED: INSERT OR REPLACE → INSERT ... ON CONFLICT DO NOTHING")
+    
+    # Convert unquoted 'user' column to quoted "user" (PostgreSQL reserved keyword)
+    # Patterns: ", user," -> ", "user","  or "(user)" -> "("user")" or " user " -> " "user" "
+    query = _PG_USER_COL_RX.sub('"user"', query)
+    query = _PG_USER_FIRST_COL_RX.sub('("user",', query)
+    return query
+
 class PostgreSQLConnectionWrapper:
     """Wrapper para adicionar método execute() à conexão PostgreSQL"""
     def __init__(self, conn):
@@ -1392,47 +2030,14 @@ class PostgreSQLConnectionWrapper:
     
     def execute(self, query, params=None):
         """Execute query usando cursor"""
-        # Convert SQLite ? placeholders to PostgreSQL %s
-        if '?' in query:
-            # Count number of ? to ensure we have right number of params
-            num_placeholders = query.count('?')
-            query = query.replace('?', '%s')
-            
-            # Ensure params is a tuple
-            if params is not None:
-                if not isinstance(params, (tuple, list)):
-                    params = (params,)
-                elif isinstance(params, list):
-                    params = tuple(params)
-        
-        # Convert SQLite AUTOINCREMENT to PostgreSQL SERIAL
-        if 'AUTOINCREMENT' in query.upper():
-            query = query.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
-            query = query.replace('AUTOINCREMENT', '')
-        
-        # Convert SQLite datetime('now') to PostgreSQL NOW()
-        if "datetime('now')" in query or 'datetime("now")' in query:
-            query = query.replace("datetime('now')", "NOW()")
-            query = query.replace('datetime("now")', "NOW()")
-        
-        # Convert INSERT OR REPLACE to INSERT ... ON CONFLICT (automatic PostgreSQL compatibility)
-        if 'INSERT OR REPLACE' in query.upper():
-            import re
-            # Replace INSERT OR REPLACE with INSERT
-            query = re.sub(r'INSERT\s+OR\s+REPLACE', 'INSERT', query, flags=re.IGNORECASE)
-            # Add ON CONFLICT DO NOTHING at the end if not already there
-            if 'ON CONFLICT' not in query.upper():
-                query = query.rstrip().rstrip(';') + ' ON CONFLICT DO NOTHING'
-            # Debug log only (not warning)
-            import logging
-            logging.debug(f"✅ AUTO-CONVERTED: INSERT OR REPLACE → INSERT ... ON CONFLICT DO NOTHING")
+        # Ensure params is a tuple for %s placeholders
+        if params is not None and '?' in query:
+            if not isinstance(params, (tuple, list)):
+                params = (params,)
+            elif isinstance(params, list):
+                params = tuple(params)
         
-        # Convert unquoted 'user' column to quoted "user" (PostgreSQL reserved keyword)
-        import re
-        # Match 'user' as column name but not in strings
-        # Patterns: ", user," -> ", "user","  or "(user)" -> "("user")" or " user " -> " "user" "
-        query = re.sub(r'\buser\b(?=\s*[,\)])', '"user"', query, flags=re.IGNORECASE)
-        query = re.sub(r'\(\s*user\s*,', '("user",', query, flags=re.IGNORECASE)
+        query = _translate_pg_query(query)
         
         self._cursor = self._conn.cursor()
         try:
@@ -1524,6 +2129,20 @@ def _is_postgresql_connection(conn):
     
     return False
 
+def _lock_table_for_update(conn, table: str):
+    """Serializa um read-modify-write (ex.: MAX(version) + 1) sobre a tabela até ao commit
+
+    No PostgreSQL o _db_lock não bloqueia (DBGate) e há vários workers; no SQLite o
+    _db_lock já serializa os escritores.
+    """
+    if isinstance(conn, sqlite3.Connection):
+        return
+    cur = conn.cursor()
+    try:
+        cur.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+    finally:
+        cur.close()
+
 def _convert_query_for_db(query, conn, params=None):
     """Convert SQLite query to PostgreSQL if needed"""
     is_postgres = _is_postgresql_connection(conn)
@@ -1653,53 +2272,169 @@ def _get_current_user_from_session(request: Request):
         return None
 
 # --- Activity Log ---
+ACTIVITY_LOG_DDL = """
+    CREATE TABLE IF NOT EXISTS activity_log (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      ts_utc TEXT NOT NULL,
+      username TEXT,
+      action TEXT NOT NULL,
+      details TEXT,
+      ip TEXT,
+      user_agent TEXT
+    );
+"""
+ACTIVITY_LOG_COLUMNS = ("ts_utc", "username", "action", "details", "ip", "user_agent")
+SYSTEM_LOG_COLUMNS = ("level", "message", "module", "function", "line_number", "exception")
+_activity_table_ready = False
+
 def _ensure_activity_table():
+    global _activity_table_ready
+    if _activity_table_ready:
+        return
     with _db_lock:
         con = _db_connect()
         try:
-            con.execute(
-                """
-                CREATE TABLE IF NOT EXISTS activity_log (
-                  id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  ts_utc TEXT NOT NULL,
-                  username TEXT,
-                  action TEXT NOT NULL,
-                  details TEXT,
-                  ip TEXT,
-                  user_agent TEXT
-                );
-                """
-            )
+            con.execute(ACTIVITY_LOG_DDL)
             con.commit()
+            _activity_table_ready = True
         finally:
             con.close()
 
+# log_activity e log_to_db só enfileiram: uma thread escreve em lote a cada LOG_FLUSH_MS
+# ou LOG_BATCH_ROWS linhas. Com o buffer cheio o produtor espera até LOG_BACKPRESSURE_MS
+# pelo writer e, se continuar cheio, a linha mais antiga é descartada (conta em "dropped").
+# No event loop nunca se espera: com o buffer cheio descarta-se logo.
+LOG_FLUSH_MS = int(os.getenv("LOG_FLUSH_MS", "250") or 250)
+LOG_BATCH_ROWS = max(1, int(os.getenv("LOG_BATCH_ROWS", "200") or 200))
+LOG_BUFFER_MAX = max(LOG_BATCH_ROWS, int(os.getenv("LOG_BUFFER_MAX", "10000") or 10000))
+LOG_BACKPRESSURE_MS = int(os.getenv("LOG_BACKPRESSURE_MS", "50") or 50)
+
+class _LogBatchWriter:
+    TABLE_COLUMNS = {"activity_log": ACTIVITY_LOG_COLUMNS, "system_logs": SYSTEM_LOG_COLUMNS}
+
+    def __init__(self):
+        self._buf: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats = {
+            "enqueued": 0, "written": 0, "dropped": 0, "backpressure_waits": 0,
+            "batches": 0, "errors": 0, "last_batch_rows": 0, "last_batch_ms": 0.0,
+        }
+
+    def submit(self, table: str, row: tuple):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="log-batch-writer", daemon=True)
+                self._thread.start()
+            if len(self._buf) >= LOG_BUFFER_MAX:
+                self._cond.notify_all()
+                if not self._on_event_loop():
+                    self.stats["backpressure_waits"] += 1
+                    self._cond.wait_for(lambda: len(self._buf) < LOG_BUFFER_MAX, timeout=LOG_BACKPRESSURE_MS / 1000)
+                if len(self._buf) >= LOG_BUFFER_MAX:
+                    self._buf.popleft()
+                    self.stats["dropped"] += 1
+            self._buf.append((table, row))
+            self.stats["enqueued"] += 1
+            if len(self._buf) >= LOG_BATCH_ROWS:
+                self._cond.notify_all()
+
+    @staticmethod
+    def _on_event_loop() -> bool:
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Dorme sem timeout com o buffer vazio; a partir da 1ª linha espera no máximo LOG_FLUSH_MS
+                self._cond.wait_for(lambda: self._stopping or self._buf)
+                self._cond.wait_for(lambda: self._stopping or len(self._buf) >= LOG_BATCH_ROWS, timeout=LOG_FLUSH_MS / 1000)
+                batch = [self._buf.popleft() for _ in range(min(len(self._buf), LOG_BATCH_ROWS))]
+                done = self._stopping and not self._buf
+                self._cond.notify_all()
+            if batch:
+                self._write(batch)
+            if done:
+                return
+
+    def _write(self, batch: List[Tuple[str, tuple]]):
+        by_table: Dict[str, List[tuple]] = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        t0 = time.perf_counter()
+        try:
+            if "activity_log" in by_table:
+                _ensure_activity_table()
+            with _db_lock:
+                con = _db_connect()
+                try:
+                    for table, rows in by_table.items():
+                        columns = self.TABLE_COLUMNS[table]
+                        if _bulk_insert_rows:
+                            _bulk_insert_rows(con, table, columns, rows)
+                        else:
+                            sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+                            for row in rows:
+                                con.execute(sql, row)
+                    con.commit()
+                except Exception:
+                    try:
+                        con.rollback()
+                    except Exception:
+                        pass
+                    raise
+                finally:
+                    con.close()
+        except Exception as e:
+            with self._cond:
+                self.stats["errors"] += 1
+            # Fallback para stderr se a BD falhar (os logs de sistema não se perdem de todo)
+            for row in by_table.get("system_logs", []):
+                print(f"[{row[0]}] {row[1]}", file=sys.stderr, flush=True)
+            print(f"[LOG WRITER] batch of {len(batch)} rows failed: {e}", file=sys.stderr, flush=True)
+            return
+        elapsed = (time.perf_counter() - t0) * 1000
+        with self._cond:
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_batch_rows"] = len(batch)
+            self.stats["last_batch_ms"] = round(elapsed, 2)
+
+    def flush(self, timeout: float = 10.0):
+        """Escreve tudo o que está no buffer e pára a thread (shutdown)"""
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {**self.stats, "pending": len(self._buf), "buffer_max": LOG_BUFFER_MAX,
+                    "flush_ms": LOG_FLUSH_MS, "batch_rows": LOG_BATCH_ROWS}
+
+_LOG_WRITER = _LogBatchWriter()
+atexit.register(_LOG_WRITER.flush)
+
 def log_activity(request: Request, action: str, details: str = "", username: Optional[str] = None):
-    try:
-        _ensure_activity_table()
-    except Exception:
-        pass
     # best-effort metadata
     try:
         ip = request.client.host if request and request.client else None
     except Exception:
         ip = None
-    ua = request.headers.get("user-agent", "") if request else ""
-    user = username or (request.session.get("username") if request and request.session else None)
     try:
-        with _db_lock:
-            con = _db_connect()
-            try:
-                con.execute(
-                    "INSERT INTO activity_log (ts_utc, username, action, details, ip, user_agent) VALUES (?,?,?,?,?,?)",
-                    (datetime.now(timezone.utc).isoformat(), user, action, details, ip or "", ua[:300])
-                )
-                con.commit()
-            finally:
-                con.close()
+        ua = request.headers.get("user-agent", "") if request else ""
+        user = username or (request.session.get("username") if request and request.session else None)
+        _LOG_WRITER.submit("activity_log", (datetime.now(timezone.utc).isoformat(), user, action, details, ip or "", ua[:300]))
     except Exception:
         pass
-    pass
 
 def cleanup_activity_retention():
     try:
@@ -1906,13 +2641,200 @@ def load_admin_vehicles() -> dict:
         logging.error(f"[ADMIN-VEHICLES] Error loading vehicles: {e}")
         return {}
     
-    # Atualizar cache
+    # Atualizar cache (grupos diferentes => classificações memorizadas deixam de valer)
+    if _admin_vehicles_cache is not None and vehicle_groups != _admin_vehicles_cache:
+        invalidate_vehicle_classifier()
     _admin_vehicles_cache = vehicle_groups
     _admin_vehicles_cache_time = now
     
     logging.info(f"[ADMIN-VEHICLES] Loaded {len(vehicle_groups)} groups from Admin Vehicles")
     return vehicle_groups
 
+# Padrões do _map_category_fallback (compilados uma vez, mesma ordem de prioridade)
+NINE_SEATER_RX = _any_rx([
+    # Ford Transit/Tourneo CUSTOM/COURIER (9 lugares)
+    # Mas NÃO Ford Tourneo genérico ou Ford Galaxy (7 lugares)
+    r'\bford\s*transit\b',
+    r'\bford\s*tourneo\s*custom\b',
+    # Mercedes Vito (9 lugares) - mas NÃO Mercedes V-Class (7 lugares)
+    r'\bmercedes\s*(benz\s*)?vito\b',
+    # Vans comerciais verdadeiras (9 lugares)
+    r'\bopel\s*vivaro\b',
+    r'\brenault\s*trafic\b',
+    r'\bpeugeot\s*traveller\b',
+    r'\bcitroen\s*spacetourer\b',
+    r'\btoyota\s*proace\b',
+    r'\bfiat\s*talento\b',
+    # VW Caravelle/Transporter (9 lugares) - mas NÃO Multivan (7 lugares)
+    r'\b(vw|volkswagen)\s*caravelle\b',
+    r'\b(vw|volkswagen)\s*transporter\b',
+], re.IGNORECASE)
+
+SEVEN_SEATER_RX = _any_rx([
+    r'\bpeugeot\s*5008\b',
+    r'\bcitro[eë]n\s*c4\s*picasso\b',
+    r'\bcitro[eë]n\s*c4\s*(grand\s*picasso|grand\s*spacetourer|grand\s*space\s*tourer)\b',
+    r'\bcitro[eë]n\s*grand\s*picasso\b',  # Variação sem C4
+    r'\brenault\s*(grand\s*)?scenic\b',
+    r'\b(vw|volkswagen)\s*caddy\b',
+    r'\b(vw|volkswagen)\s*multivan\b',  # 7 lugares (removido de 9)
+    r'\b(vw|volkswagen)\s*sharan\b',
+    r'\b(vw|volkswagen)\s*touran\b',
+    r'\bdacia\s*lodgy\b',
+    r'\bdacia\s*jogger\b',
+    r'\bpeugeot\s*rifter\b',
+    r'\bford\s*s[-\s]?max\b',
+    r'\bford\s*galaxy\b',
+    r'\bford\s*tourneo\b',  # 7 lugares genérico (removido de 9)
+    r'\bopel\s*zafira\b',
+    r'\bopel\s*combo\b',
+    r'\bseat\s*alhambra\b',
+    r'\bskoda\s*kodiaq\b',
+    r'\bmercedes\s*glb\b',  # Mercedes GLB 7 Seater
+    r'\bmercedes\s*v[-\s]?class\b',  # 7 lugares (removido de 9)
+], re.IGNORECASE)
+
+# Exceções 7 lugares que o CarJet categoriza como SUV
+SUV_SEVEN_SEATER_RX = _any_rx([
+    r'\bpeugeot\s*5008\b',
+    r'\bcitro[eë]n\s*c4\s*picasso\b',
+    r'\bcitro[eë]n\s*c4\s*(grand\s*picasso|grand\s*spacetourer|grand\s*space\s*tourer)\b',
+    r'\brenault\s*(grand\s*)?scenic\b',
+    r'\b(vw|volkswagen)\s*caddy\b',
+    r'\bdacia\s*lodgy\b',
+    r'\bdacia\s*jogger\b',
+    r'\bpeugeot\s*rifter\b',
+    r'\bford\s*s[-\s]?max\b',
+    r'\bford\s*galaxy\b',
+    r'\bopel\s*zafira\b',
+    r'\b(vw|volkswagen)\s*touran\b',
+    r'\b(vw|volkswagen)\s*sharan\b',
+    r'\bseat\s*alhambra\b',
+    r'\bpeugeot\s*traveller\b',
+    r'\bopel\s*combo\b',
+], re.IGNORECASE)
+
+# Station Wagons que o CarJet categoriza como Economy
+ECONOMY_SW_RX = _any_rx([
+    r'\bfocus\s*sw\b',
+    r'\b308\s*sw\b',
+    r'\bastra\s*sw\b',
+    r'\bcorolla\s*sw\b',
+    r'\boctavia\s*sw\b',
+    r'\bgolf\s*sw\b',
+    r'\bleon\s*sw\b',
+    r'\b\w+\s+sw\b',  # Qualquer "X SW"
+    r'\bstation\s*wagon\b',
+    r'\bestate\b',
+    r'\btouring\b',
+], re.IGNORECASE)
+
+SW_SPELLING_RX = re.compile(r'\bs[\.\s]*w\b', re.IGNORECASE)
+ELECTRIC_NAME_RX = re.compile(r'\b(electric|eléctric|électric|elétric)\b')
+AUTO_NAME_RX = re.compile(r'\b(auto|automatic|automático|automatico)\b')
+VEHICLE_SUFFIX_RXS = (
+    re.compile(r'\s+(electric|hybrid|diesel|petrol|plug-in|phev)$', re.IGNORECASE),
+    re.compile(r'\s+4x4$', re.IGNORECASE),
+    re.compile(r'\s+\d+\s*door(s)?$', re.IGNORECASE),
+    re.compile(r',\s*electric$', re.IGNORECASE),
+    re.compile(r',\s*hybrid$', re.IGNORECASE),
+)
+
+
+class _VehicleIndex:
+    """Índice do VEHICLES (carjet_direct.py) para o _map_category_fallback
+
+    As listas mantêm a ordem dos loops originais (tamanho decrescente, empates pela
+    ordem do dicionário). O match parcial usa um índice pelos 3 primeiros caracteres
+    de cada chave em vez de percorrer as ~600 chaves por carro.
+    """
+
+    def __init__(self, vehicles: dict):
+        self.vehicles = vehicles
+        self.size = len(vehicles)
+        by_len = sorted(vehicles.keys(), key=len, reverse=True)
+        self.sw_keys = [(k, k.replace(' sw', '').strip()) for k in by_len if 'sw' in k.lower()]
+        self.electric_keys = [k for k in by_len if 'electric' in k.lower()]
+        self.auto_keys = [k for k in by_len if 'auto' in k.lower()]
+        self.group_codes = {k: _map_category_to_group_code(v) for k, v in vehicles.items()}
+        self._prefix: Dict[str, List[Tuple[int, str]]] = {}
+        for rank, key in enumerate(by_len):
+            if len(key) >= 5:
+                self._prefix.setdefault(key[:3], []).append((rank, key))
+
+    def is_current(self, vehicles: dict) -> bool:
+        return self.vehicles is vehicles and self.size == len(vehicles)
+
+    def partial_match(self, name: str) -> Optional[str]:
+        """Primeira chave (len >= 5, mais longa primeiro) contida em name"""
+        best = None
+        for i in range(len(name) - 4):
+            for rank, key in self._prefix.get(name[i:i + 3], ()):
+                if (best is None or rank < best[0]) and name.startswith(key, i):
+                    best = (rank, key)
+        return best[1] if best else None
+
+
+def _get_vehicle_index() -> Optional[_VehicleIndex]:
+    """Devolve o índice do VEHICLES atual, reconstruindo-o se o módulo foi recarregado"""
+    global _vehicle_index
+    try:
+        from carjet_direct import VEHICLES
+    except ImportError:
+        return None
+    index = _vehicle_index
+    if index is None or not index.is_current(VEHICLES):
+        index = _VehicleIndex(VEHICLES)
+        _vehicle_index = index
+        _vehicle_group_memo.clear()
+        _vehicle_classifier_stats["rebuilds"] += 1
+    return index
+
+
+def _load_car_group_names() -> Dict[str, str]:
+    """LOWER(name)/LOWER(model) → code da tabela car_groups (primeira linha ganha, como o fetchone)"""
+    global _car_group_names
+    names = _car_group_names
+    if names is not None:
+        return names
+    with _db_lock:
+        conn = _db_connect()
+        try:
+            if conn.__class__.__module__ == 'psycopg2.extensions':
+                with conn.cursor() as cur:
+                    cur.execute("SELECT code, name, model FROM car_groups")
+                    rows = cur.fetchall()
+            else:
+                rows = conn.execute("SELECT code, name, model FROM car_groups").fetchall()
+        finally:
+            conn.close()
+    names = {}
+    for code, name, model in rows:
+        for value in (name, model):
+            if value:
+                names.setdefault(str(value).lower(), code)
+    _car_group_names = names
+    return names
+
+
+def invalidate_vehicle_classifier() -> None:
+    """Esquece classificações memorizadas (chamar após alterar car_groups/vehicle_name_overrides/VEHICLES)"""
+    global _vehicle_index, _car_group_names
+    _vehicle_index = None
+    _car_group_names = None
+    _vehicle_group_memo.clear()
+
+
+def get_vehicle_classifier_stats() -> dict:
+    index = _vehicle_index
+    return {
+        **_vehicle_classifier_stats,
+        "memo_entries": len(_vehicle_group_memo),
+        "memo_max": VEHICLE_GROUP_MEMO_MAX,
+        "vehicles_indexed": index.size if index else 0,
+    }
+
+
 def map_category_to_group(category: str, car_name: str = "", transmission: str = "") -> str:
     """
     Mapeia categorias descritivas para códigos de grupos definidos:
@@ -1925,6 +2847,9 @@ def map_category_to_group(category: str, car_name: str = "", transmission: str =
     2. VEHICLES dictionary (carjet_direct.py) → grupos definidos manualmente
     3. Fallback (_map_category_fallback) → categoria/keywords
     
+    O resultado fica memorizado por (category, car_name, transmission) até
+    invalidate_vehicle_classifier() ou até o VEHICLES/Admin Vehicles mudarem.
+    
     Args:
         category: Categoria descritiva ex. "Economy", "SUV Auto"
         car_name: Nome do carro ex. "VW Golf"
@@ -1933,141 +2858,166 @@ def map_category_to_group(category: str, car_name: str = "", transmission: str =
     Returns:
         Código do grupo ex. "B1", "D", "L1", "Others"
     """
-    # CRITICAL LOGGING: Track ALL cars entering mapping
-    logging.info(f" [MAP-IN] car='{car_name}' | category='{category}' | transmission='{transmission}'")
+    logging.debug(f" [MAP-IN] car='{car_name}' | category='{category}' | transmission='{transmission}'")
     
-    cat = category.strip().lower() if category else ""
-    car_lower = car_name.lower() if car_name else ""
-    trans_lower = transmission.lower() if transmission else ""
+    _get_vehicle_index()
+    vehicle_groups = load_admin_vehicles() if match_vehicle_group_by_characteristics and car_name else None
+    
+    memo_key = (category or "", car_name or "", transmission or "")
+    cached = _vehicle_group_memo.get(memo_key)
+    if cached is not None:
+        _vehicle_classifier_stats["hits"] += 1
+        return cached
+    _vehicle_classifier_stats["misses"] += 1
+    
+    final_group = _classify_vehicle_group(category, car_name, transmission, vehicle_groups)
+    
+    if len(_vehicle_group_memo) >= VEHICLE_GROUP_MEMO_MAX:
+        _vehicle_group_memo.clear()
+    _vehicle_group_memo[memo_key] = final_group
+    return final_group
 
+def _classify_vehicle_group(category: str, car_name: str, transmission: str, vehicle_groups) -> str:
+    """Classificação sem memo (ver map_category_to_group)"""
     # PRIORIDADE 0: Matching inteligente baseado em Admin Vehicles
-    if match_vehicle_group_by_characteristics and car_name:
-        vehicle_groups = load_admin_vehicles()
-        if vehicle_groups:
-            # Criar função fallback que é a lógica atual
-            def fallback(cat, name):
-                return _map_category_fallback(cat, name, transmission)
-            
-            matched_group = match_vehicle_group_by_characteristics(
-                category, car_name, transmission, vehicle_groups, fallback
-            )
-            
-            # Se encontrou match válido (não "Others"), usar
-            if matched_group and matched_group != "Others":
-                logging.info(f"[SMART-MATCH] {car_name} ({category}) → {matched_group} (via Admin characteristics)")
-                return matched_group
+    if vehicle_groups:
+        matched_group = match_vehicle_group_by_characteristics(
+            category, car_name, transmission, vehicle_groups,
+            partial(_map_category_fallback, transmission=transmission)
+        )
+        
+        # Se encontrou match válido (não "Others"), usar
+        if matched_group and matched_group != "Others":
+            logging.debug(f"[SMART-MATCH] {car_name} ({category}) → {matched_group} (via Admin characteristics)")
+            return matched_group
     
     # Fallback para lógica original
     final_group = _map_category_fallback(category, car_name, transmission)
-    logging.info(f"📤 [MAP-OUT] car='{car_name}' → grupo '{final_group}' | original category='{category}'")
+    logging.debug(f"📤 [MAP-OUT] car='{car_name}' → grupo '{final_group}' | original category='{category}'")
     return final_group
 
+# Dicionário de mapeamento DIRETO (categoria → grupo)
+CATEGORY_GROUP_CODES = {
+    # B1 - Mini 4 Lugares
+    "mini 4 doors": "B1",
+    "mini 4 seats": "B1",
+    "mini 4 portas": "B1",
+    "mini 4 lugares": "B1",
+    
+    # B2 - Mini 5 Lugares
+    "mini": "B2",
+    "mini 5 doors": "B2",
+    "mini 5 seats": "B2",
+    "mini 5 portas": "B2",
+    "mini 5 lugares": "B2",
+    
+    # D - Economy
+    "economy": "D",
+    "económico": "D",
+    "compact": "D",
+    "compacto": "D",
+    
+    # E1 - Mini Automatic
+    "mini automatic": "E1",
+    "mini auto": "E1",
+    "mini automático": "E1",
+    
+    # E2 - Economy Automatic
+    "economy automatic": "E2",
+    "economy auto": "E2",
+    "económico automatic": "E2",
+    "económico auto": "E2",
+    "compact automatic": "E2",
+    "compact auto": "E2",
+    
+    # F - SUV
+    "suv": "F",
+    "jeep": "F",
+    
+    # G - Cabrio
+    "cabrio": "G",
+    "cabriolet": "G",
+    "convertible": "G",
+    "conversível": "G",
+    
+    # J1 - Crossover
+    "crossover": "J1",
+    
+    # J2 - Station Wagon
+    "estate/station wagon": "J2",
+    "station wagon": "J2",
+    "estate": "J2",
+    "carrinha": "J2",
+    "sw": "J2",
+    "touring": "J2",
+    
+    # L1 - SUV Automatic
+    "suv automatic": "L1",
+    "suv auto": "L1",
+    "jeep automatic": "L1",
+    "jeep auto": "L1",
+    
+    # L2 - Station Wagon Automatic
+    "station wagon automatic": "L2",
+    "station wagon auto": "L2",
+    "estate automatic": "L2",
+    "estate auto": "L2",
+    "carrinha automatic": "L2",
+    "carrinha auto": "L2",
+    "sw automatic": "L2",
+    "sw auto": "L2",
+    
+    # M1 - 7 Seater
+    "7 seater": "M1",
+    "7 seats": "M1",
+    "7 lugares": "M1",
+    "people carrier": "M1",
+    "mpv": "M1",
+    
+    # M2 - 7 Seater Automatic
+    "7 seater automatic": "M2",
+    "7 seater auto": "M2",
+    "7 seats automatic": "M2",
+    "7 seats auto": "M2",
+    "7 lugares automatic": "M2",
+    "7 lugares auto": "M2",
+    "7 lugares automático": "M2",
+    
+    # N - 9 Seater
+    "9 seater": "N",
+    "9 seats": "N",
+    "9 lugares": "N",
+    
+    # X - Luxury
+    "luxury": "X",
+    "premium": "X",
+    "luxo": "X",
+}
+
+# Mapeamento direto do _map_category_fallback: o de cima mais as variantes
+# automáticas de MPV/9 lugares e minivan/van que só o fallback aceita
+CATEGORY_MAP_FALLBACK = {
+    **CATEGORY_GROUP_CODES,
+    "mpv automatic": "M2",
+    "mpv auto": "M2",
+    "9 seater automatic": "N",
+    "9 seater auto": "N",
+    "9 seats automatic": "N",
+    "9 seats auto": "N",
+    "9 lugares automatic": "N",
+    "9 lugares auto": "N",
+    "9 lugares automático": "N",
+    "minivan": "N",
+    "van": "N",
+}
+
 def _map_category_to_group_code(category: str) -> str:
     """
     Mapeia categoria descritiva (do VEHICLES ou CarJet) para código de grupo.
     CONVERSÃO DIRETA sem lógica de fallback.
     """
     cat = category.strip().lower() if category else ""
-    
-    # Dicionário de mapeamento DIRETO
-    mapping = {
-        # B1 - Mini 4 Lugares
-        "mini 4 doors": "B1",
-        "mini 4 seats": "B1",
-        "mini 4 portas": "B1",
-        "mini 4 lugares": "B1",
-        
-        # B2 - Mini 5 Lugares
-        "mini": "B2",
-        "mini 5 doors": "B2",
-        "mini 5 seats": "B2",
-        "mini 5 portas": "B2",
-        "mini 5 lugares": "B2",
-        
-        # D - Economy
-        "economy": "D",
-        "económico": "D",
-        "compact": "D",
-        "compacto": "D",
-        
-        # E1 - Mini Automatic
-        "mini automatic": "E1",
-        "mini auto": "E1",
-        "mini automático": "E1",
-        
-        # E2 - Economy Automatic
-        "economy automatic": "E2",
-        "economy auto": "E2",
-        "económico automatic": "E2",
-        "económico auto": "E2",
-        "compact automatic": "E2",
-        "compact auto": "E2",
-        
-        # F - SUV
-        "suv": "F",
-        "jeep": "F",
-        
-        # G - Cabrio
-        "cabrio": "G",
-        "cabriolet": "G",
-        "convertible": "G",
-        "conversível": "G",
-        
-        # J1 - Crossover
-        "crossover": "J1",
-        
-        # J2 - Station Wagon
-        "estate/station wagon": "J2",
-        "station wagon": "J2",
-        "estate": "J2",
-        "carrinha": "J2",
-        "sw": "J2",
-        "touring": "J2",
-        
-        # L1 - SUV Automatic
-        "suv automatic": "L1",
-        "suv auto": "L1",
-        "jeep automatic": "L1",
-        "jeep auto": "L1",
-        
-        # L2 - Station Wagon Automatic
-        "station wagon automatic": "L2",
-        "station wagon auto": "L2",
-        "estate automatic": "L2",
-        "estate auto": "L2",
-        "carrinha automatic": "L2",
-        "carrinha auto": "L2",
-        "sw automatic": "L2",
-        "sw auto": "L2",
-        
-        # M1 - 7 Seater
-        "7 seater": "M1",
-        "7 seats": "M1",
-        "7 lugares": "M1",
-        "people carrier": "M1",
-        "mpv": "M1",
-        
-        # M2 - 7 Seater Automatic
-        "7 seater automatic": "M2",
-        "7 seater auto": "M2",
-        "7 seats automatic": "M2",
-        "7 seats auto": "M2",
-        "7 lugares automatic": "M2",
-        "7 lugares auto": "M2",
-        "7 lugares automático": "M2",
-        
-        # N - 9 Seater
-        "9 seater": "N",
-        "9 seats": "N",
-        "9 lugares": "N",
-        
-        # X - Luxury
-        "luxury": "X",
-        "premium": "X",
-        "luxo": "X",
-    }
-    
-    return mapping.get(cat, None)
+    return CATEGORY_GROUP_CODES.get(cat, None)
 
 def _map_category_fallback(category: str, car_name: str = "", transmission: str = "") -> str:
     """Lógica de fallback original para mapeamento de categorias"""
@@ -2076,45 +3026,20 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
     car_lower = car_name.lower() if car_name else ""
     trans_lower = transmission.lower() if transmission else ""
     
-    logging.info(f"📋 [MAP] ENTRADA: car='{car_name}', category='{category}', transmission='{transmission}'")
+    logging.debug(f"📋 [MAP] ENTRADA: car='{car_name}', category='{category}', transmission='{transmission}'")
     
     # PRIORIDADE -1: CABRIO/CABRIOLET no NOME → SEMPRE Grupo G
     # Independente da categoria (Luxury, Mini, SUV, etc), se tem "cabrio" no nome = G
     if any(word in car_lower for word in ['cabrio', 'cabriolet', 'convertible', 'conversível']):
-        logging.info(f"✅ [MAP] SUCESSO (cabrio no nome): car='{car_name}' → grupo 'G' (Cabrio)")
+        logging.debug(f"✅ [MAP] SUCESSO (cabrio no nome): car='{car_name}' → grupo 'G' (Cabrio)")
         return "G"
     
     # PRIORIDADE -0.5: VEÍCULOS 9 LUGARES → SEMPRE N (9 Seater)
     # ANTES de verificar 7 lugares!
-    # IMPORTANTE: Ser MUITO específico para não capturar 7 lugares por engano
-    import re
-    
-    nine_seater_patterns = [
-        # Ford Transit/Tourneo CUSTOM/COURIER (9 lugares)
-        # Mas NÃO Ford Tourneo genérico ou Ford Galaxy (7 lugares)
-        r'\bford\s*transit\b',
-        r'\bford\s*tourneo\s*custom\b',
-        
-        # Mercedes Vito (9 lugares) - mas NÃO Mercedes V-Class (7 lugares)
-        r'\bmercedes\s*(benz\s*)?vito\b',
-        
-        # Vans comerciais verdadeiras (9 lugares)
-        r'\bopel\s*vivaro\b',
-        r'\brenault\s*trafic\b',
-        r'\bpeugeot\s*traveller\b',
-        r'\bcitroen\s*spacetourer\b',
-        r'\btoyota\s*proace\b',
-        r'\bfiat\s*talento\b',
-        
-        # VW Caravelle/Transporter (9 lugares) - mas NÃO Multivan (7 lugares)
-        r'\b(vw|volkswagen)\s*caravelle\b',
-        r'\b(vw|volkswagen)\s*transporter\b',
-    ]
-    
-    for pattern in nine_seater_patterns:
-        if re.search(pattern, car_lower, re.IGNORECASE):
-            logging.info(f"✅ [MAP] SUCESSO (9 lugares pattern): car='{car_name}' → grupo 'N' (9 Seater)")
-            return "N"  # 9 Seater - PRIORIDADE MÁXIMA!
+    # IMPORTANTE: Ser MUITO específico para não capturar 7 lugares por engano (NINE_SEATER_RX)
+    if NINE_SEATER_RX.search(car_lower):
+        logging.debug(f"✅ [MAP] SUCESSO (9 lugares pattern): car='{car_name}' → grupo 'N' (9 Seater)")
+        return "N"  # 9 Seater - PRIORIDADE MÁXIMA!
     
     # PRIORIDADE -0.4: VEÍCULOS 7 LUGARES → SEMPRE M1/M2
     # Independente da categoria que CarJet envie!
@@ -2124,45 +3049,21 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
     is_auto = any(word in trans_lower for word in ['auto', 'automatic', 'automático', 'automatico'])
     
     # DEBUG: Log da decisão M1/M2
-    logging.info(f"🔍 [7-SEATER-CHECK] car='{car_name}' | transmission='{transmission}' | is_auto={is_auto}")
-    
-    seven_seater_patterns = [
-        r'\bpeugeot\s*5008\b',
-        r'\bcitro[eë]n\s*c4\s*picasso\b',
-        r'\bcitro[eë]n\s*c4\s*(grand\s*picasso|grand\s*spacetourer|grand\s*space\s*tourer)\b',
-        r'\bcitro[eë]n\s*grand\s*picasso\b',  # Variação sem C4
-        r'\brenault\s*(grand\s*)?scenic\b',
-        r'\b(vw|volkswagen)\s*caddy\b',
-        r'\b(vw|volkswagen)\s*multivan\b',  # 7 lugares (removido de 9)
-        r'\b(vw|volkswagen)\s*sharan\b',
-        r'\b(vw|volkswagen)\s*touran\b',
-        r'\bdacia\s*lodgy\b',
-        r'\bdacia\s*jogger\b',
-        r'\bpeugeot\s*rifter\b',
-        r'\bford\s*s[-\s]?max\b',
-        r'\bford\s*galaxy\b',
-        r'\bford\s*tourneo\b',  # 7 lugares genérico (removido de 9)
-        r'\bopel\s*zafira\b',
-        r'\bopel\s*combo\b',
-        r'\bseat\s*alhambra\b',
-        r'\bskoda\s*kodiaq\b',
-        r'\bmercedes\s*glb\b',  # Mercedes GLB 7 Seater
-        r'\bmercedes\s*v[-\s]?class\b',  # 7 lugares (removido de 9)
-    ]
+    logging.debug(f"🔍 [7-SEATER-CHECK] car='{car_name}' | transmission='{transmission}' | is_auto={is_auto}")
     
-    for pattern in seven_seater_patterns:
-        if re.search(pattern, car_lower, re.IGNORECASE):
-            grupo = "M2" if is_auto else "M1"
-            logging.info(f"✅ [MAP] SUCESSO (7 lugares pattern): car='{car_name}' → grupo '{grupo}' (7 Seater)")
-            return grupo  # 7 Seater - PRIORIDADE MÁXIMA!
+    if SEVEN_SEATER_RX.search(car_lower):
+        grupo = "M2" if is_auto else "M1"
+        logging.debug(f"✅ [MAP] SUCESSO (7 lugares pattern): car='{car_name}' → grupo '{grupo}' (7 Seater)")
+        return grupo  # 7 Seater - PRIORIDADE MÁXIMA!
     
     # PRIORIDADE 0: Consultar dicionário VEHICLES de carjet_direct.py
     # NOSSA PARAMETRIZAÇÃO TEM PRIORIDADE SOBRE CATEGORIAS CARJET!
     # PRIORIDADE 0: Consultar VEHICLES (carjet_direct.py) com fallback inteligente
     # Se o carro está em VEHICLES, usar categoria de lá SEMPRE!
-    if car_name:
+    index = _get_vehicle_index() if car_name else None
+    if index is not None:
         try:
-            from carjet_direct import VEHICLES
+            VEHICLES = index.vehicles
             
             # Normalizar nome do carro para consulta (lowercase)
             car_clean = clean_car_name(car_name)
@@ -2171,46 +3072,39 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
             # ✅ PRIORIDADE MÁXIMA 1: Station Wagons (SW) ANTES de qualquer normalização
             # Garantir que "Ford Focus SW" nunca é mapeado como "Ford Focus" (Economy)
             # Suportar variações: SW, S W, S.W., S. W.
-            car_normalized_sw = re.sub(r'\bs[\.\s]*w\b', 'sw', car_clean_lower, flags=re.IGNORECASE)
+            car_normalized_sw = SW_SPELLING_RX.sub('sw', car_clean_lower)
             if 'sw' in car_normalized_sw:
-                logging.info(f"[SW-DETECT] Detectado SW em: {car_name} (normalizado: {car_normalized_sw})")
-                # Verificar se existe match exato com SW no VEHICLES
-                for sw_key in sorted([k for k in VEHICLES.keys() if 'sw' in k.lower()], key=len, reverse=True):
-                    # Remover SW da key para match base
-                    base_key = sw_key.replace(' sw', '').strip()
+                logging.debug(f"[SW-DETECT] Detectado SW em: {car_name} (normalizado: {car_normalized_sw})")
+                car_sw_base = car_normalized_sw.replace(' sw', '')
+                # Verificar se existe match exato com SW no VEHICLES (chave e chave sem SW)
+                for sw_key, base_key in index.sw_keys:
                     if (sw_key in car_normalized_sw or 
                         base_key in car_normalized_sw or 
-                        car_normalized_sw.replace(' sw', '') in base_key):
-                        category_from_vehicles = VEHICLES[sw_key]
-                        grupo_code = _map_category_to_group_code(category_from_vehicles)
+                        car_sw_base in base_key):
+                        grupo_code = index.group_codes[sw_key]
                         if grupo_code:
-                            logging.info(f"✅ [SW-PRIORITY] {car_name} → {sw_key} → {category_from_vehicles} → {grupo_code}")
+                            logging.debug(f"✅ [SW-PRIORITY] {car_name} → {sw_key} → {VEHICLES[sw_key]} → {grupo_code}")
                             return grupo_code
             
             # ✅ PRIORIDADE MÁXIMA 2: Carros ELECTRIC ANTES de AUTO (mais específico)
             # Garantir que "Peugeot 2008 Electric" não é mapeado como "Peugeot 2008" (J1)
-            if re.search(r'\b(electric|eléctric|électric|elétric)\b', car_clean_lower):
-                # Verificar se existe match exato com versão ELECTRIC no VEHICLES
-                # Tentar matches mais específicos primeiro (ordenar por tamanho decrescente)
-                for electric_key in sorted([k for k in VEHICLES.keys() if 'electric' in k.lower()], key=len, reverse=True):
+            if ELECTRIC_NAME_RX.search(car_clean_lower):
+                # Tentar matches mais específicos primeiro (ordenados por tamanho decrescente)
+                for electric_key in index.electric_keys:
                     if electric_key in car_clean_lower or car_clean_lower in electric_key:
-                        category_from_vehicles = VEHICLES[electric_key]
-                        grupo_code = _map_category_to_group_code(category_from_vehicles)
+                        grupo_code = index.group_codes[electric_key]
                         if grupo_code:
-                            logging.info(f"✅ [ELECTRIC-PRIORITY] {car_name} → {electric_key} → {category_from_vehicles} → {grupo_code}")
+                            logging.debug(f"✅ [ELECTRIC-PRIORITY] {car_name} → {electric_key} → {VEHICLES[electric_key]} → {grupo_code}")
                             return grupo_code
             
             # ✅ PRIORIDADE MÁXIMA 3: Carros AUTO ANTES de match parcial
             # Garantir que "Mercedes V Class Auto" não é mapeado como "Mercedes V Class" (M1)
-            if re.search(r'\b(auto|automatic|automático|automatico)\b', car_clean_lower):
-                # Verificar se existe match exato com versão AUTO no VEHICLES
-                # Tentar matches mais específicos primeiro (ordenar por tamanho decrescente)
-                for auto_key in sorted([k for k in VEHICLES.keys() if 'auto' in k.lower()], key=len, reverse=True):
+            if AUTO_NAME_RX.search(car_clean_lower):
+                for auto_key in index.auto_keys:
                     if auto_key in car_clean_lower:
-                        category_from_vehicles = VEHICLES[auto_key]
-                        grupo_code = _map_category_to_group_code(category_from_vehicles)
+                        grupo_code = index.group_codes[auto_key]
                         if grupo_code:
-                            logging.info(f"✅ [AUTO-PRIORITY] {car_name} → {auto_key} → {category_from_vehicles} → {grupo_code}")
+                            logging.debug(f"✅ [AUTO-PRIORITY] {car_name} → {auto_key} → {VEHICLES[auto_key]} → {grupo_code}")
                             return grupo_code
             
             # Remover sufixos comuns que impedem match
@@ -2221,52 +3115,33 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
             
             # Primeiro tentar match direto COM sufixos (ex: "toyota hilux 4x4")
             if car_normalized in VEHICLES:
-                category_from_vehicles = VEHICLES[car_normalized]
-                grupo_code = _map_category_to_group_code(category_from_vehicles)
+                grupo_code = index.group_codes[car_normalized]
                 if grupo_code:
-                    logging.info(f"✅ [VEHICLES-DIRECT] {car_name} → {category_from_vehicles} → {grupo_code}")
+                    logging.debug(f"✅ [VEHICLES-DIRECT] {car_name} → {VEHICLES[car_normalized]} → {grupo_code}")
                     return grupo_code
             
             # Se não encontrar, remover sufixos para tentar match parcial
-            car_normalized = re.sub(r'\s+(electric|hybrid|diesel|petrol|plug-in|phev)$', '', car_normalized, flags=re.IGNORECASE)
-            car_normalized = re.sub(r'\s+4x4$', '', car_normalized, flags=re.IGNORECASE)
-            car_normalized = re.sub(r'\s+\d+\s*door(s)?$', '', car_normalized, flags=re.IGNORECASE)
-            car_normalized = re.sub(r',\s*electric$', '', car_normalized, flags=re.IGNORECASE)
-            car_normalized = re.sub(r',\s*hybrid$', '', car_normalized, flags=re.IGNORECASE)
+            for suffix_rx in VEHICLE_SUFFIX_RXS:
+                car_normalized = suffix_rx.sub('', car_normalized)
             car_normalized = car_normalized.strip()
             
-            # Tentar match direto
+            # Tentar match direto, depois parcial (chave mais longa contida no nome)
+            # Ex: "toyota chr auto" contém "toyota chr"
             if car_normalized in VEHICLES:
-                category_from_vehicles = VEHICLES[car_normalized]
+                vehicle_key, match_kind = car_normalized, "DIRECT"
+            else:
+                vehicle_key, match_kind = index.partial_match(car_normalized), "PARTIAL-DIRECT"
+            if vehicle_key is not None:
+                category_from_vehicles = VEHICLES[vehicle_key]
                 # ✅ MAPEAR DIRETAMENTE para código de grupo (B1, D, F, etc)
                 # NÃO passar por fallback que pode sobrescrever!
-                grupo_code = _map_category_to_group_code(category_from_vehicles)
+                grupo_code = index.group_codes[vehicle_key]
                 if grupo_code:
-                    logging.info(f"✅ [VEHICLES-DIRECT] {car_name} → {category_from_vehicles} → {grupo_code} (ignoring CarJet: {category})")
+                    logging.debug(f"✅ [VEHICLES-{match_kind}] {car_name} (matched: {vehicle_key}) → {category_from_vehicles} → {grupo_code} (ignoring CarJet: {category})")
                     return grupo_code
-                else:
-                    # Se não conseguir mapear direto, usar fallback
-                    logging.info(f"🎯 VEHICLES MATCH: {car_name} → {category_from_vehicles} (ignoring CarJet: {category})")
-                    return _map_category_fallback(category_from_vehicles, car_name, transmission)
-            
-            # Tentar match parcial (buscar chave que está contida no nome ou vice-versa)
-            # Ordenar por tamanho decrescente para pegar matches mais específicos primeiro
-            for vehicle_key in sorted(VEHICLES.keys(), key=len, reverse=True):
-                # Match se o nome do carro contém a chave completa
-                # Ex: "toyota chr auto" contém "toyota chr"
-                if len(vehicle_key) >= 5 and vehicle_key in car_normalized:
-                    category_from_vehicles = VEHICLES[vehicle_key]
-                    # ✅ MAPEAR DIRETAMENTE para código de grupo
-                    grupo_code = _map_category_to_group_code(category_from_vehicles)
-                    if grupo_code:
-                        logging.info(f"✅ [VEHICLES-PARTIAL-DIRECT] {car_name} (matched: {vehicle_key}) → {category_from_vehicles} → {grupo_code} (ignoring CarJet: {category})")
-                        return grupo_code
-                    else:
-                        # Se não conseguir mapear direto, usar fallback
-                        logging.info(f"🎯 VEHICLES PARTIAL MATCH: {car_name} → {category_from_vehicles} (ignoring CarJet: {category})")
-                        return _map_category_fallback(category_from_vehicles, car_name, transmission)
-        except ImportError:
-            pass  # carjet_direct.py não disponível
+                # Se não conseguir mapear direto, usar fallback
+                logging.debug(f"🎯 VEHICLES MATCH: {car_name} → {category_from_vehicles} (ignoring CarJet: {category})")
+                return _map_category_fallback(category_from_vehicles, car_name, transmission)
         except Exception as e:
             logging.debug(f"Error consulting VEHICLES: {e}")
             pass  # Se falhar, continuar para próxima prioridade
@@ -2298,26 +3173,10 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
     # EXCEÇÃO: Station Wagons categorizados como Economy devem ir para J2/L2
     if cat in ['economy', 'económico', 'compact', 'compacto']:
         logging.debug(f"[MAP] Matched 'Economy' category: cat='{cat}', trans='{trans_lower}'")
-        import re
         # Verificar se é Station Wagon (SW) antes de categorizar como Economy
-        sw_patterns = [
-            r'\bfocus\s*sw\b',
-            r'\b308\s*sw\b',
-            r'\bastra\s*sw\b',
-            r'\bcorolla\s*sw\b',
-            r'\boctavia\s*sw\b',
-            r'\bgolf\s*sw\b',
-            r'\bleon\s*sw\b',
-            r'\b\w+\s+sw\b',  # Qualquer "X SW"
-            r'\bstation\s*wagon\b',
-            r'\bestate\b',
-            r'\btouring\b',
-        ]
-        
-        for pattern in sw_patterns:
-            if re.search(pattern, car_lower, re.IGNORECASE):
-                is_auto = any(word in trans_lower for word in ['auto', 'automatic', 'automático', 'automatico'])
-                return "L2" if is_auto else "J2"  # Station Wagon
+        if ECONOMY_SW_RX.search(car_lower):
+            is_auto = any(word in trans_lower for word in ['auto', 'automatic', 'automático', 'automatico'])
+            return "L2" if is_auto else "J2"  # Station Wagon
         
         # Normal Economy logic (só se não for SW)
         is_auto = any(word in trans_lower for word in ['auto', 'automatic', 'automático', 'automatico'])
@@ -2328,25 +3187,9 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
     if cat in ['economy automatic', 'economy auto', 'económico automatic', 'económico auto',
                'compact automatic', 'compact auto']:
         logging.debug(f"[MAP] Matched 'Economy Automatic' category: cat='{cat}'")
-        import re
         # Verificar se é Station Wagon antes de retornar E2
-        sw_patterns = [
-            r'\bfocus\s*sw\b',
-            r'\b308\s*sw\b',
-            r'\bastra\s*sw\b',
-            r'\bcorolla\s*sw\b',
-            r'\boctavia\s*sw\b',
-            r'\bgolf\s*sw\b',
-            r'\bleon\s*sw\b',
-            r'\b\w+\s+sw\b',
-            r'\bstation\s*wagon\b',
-            r'\bestate\b',
-            r'\btouring\b',
-        ]
-        
-        for pattern in sw_patterns:
-            if re.search(pattern, car_lower, re.IGNORECASE):
-                return "L2"  # Station Wagon Auto
+        if ECONOMY_SW_RX.search(car_lower):
+            return "L2"  # Station Wagon Auto
         
         return "E2"  # Economy Auto normal
     
@@ -2354,62 +3197,20 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
     # EXCEÇÕES: Veículos 7 lugares que CarJet categoriza como SUV
     # Estes modelos SÃO 7 lugares mas CarJet os categoriza incorretamente como SUV!
     if cat in ['suv', 'jeep']:
-        import re
         is_auto = any(word in trans_lower for word in ['auto', 'automatic', 'automático', 'automatico'])
         
         # Verificar TODOS os modelos 7 lugares conhecidos
-        seven_seater_models = [
-            (r'\bpeugeot\s*5008\b', 'Peugeot 5008'),
-            (r'\bcitro[eë]n\s*c4\s*picasso\b', 'Citroen C4 Picasso'),
-            (r'\bcitro[eë]n\s*c4\s*(grand\s*picasso|grand\s*spacetourer|grand\s*space\s*tourer)\b', 'Citroen Grand Picasso/Spacetourer'),
-            (r'\brenault\s*(grand\s*)?scenic\b', 'Renault Grand Scenic'),
-            (r'\b(vw|volkswagen)\s*caddy\b', 'VW Caddy'),
-            (r'\bdacia\s*lodgy\b', 'Dacia Lodgy'),
-            (r'\bdacia\s*jogger\b', 'Dacia Jogger'),
-            (r'\bpeugeot\s*rifter\b', 'Peugeot Rifter'),
-            (r'\bford\s*s[-\s]?max\b', 'Ford S-Max'),
-            (r'\bford\s*galaxy\b', 'Ford Galaxy'),
-            (r'\bopel\s*zafira\b', 'Opel Zafira'),
-            (r'\b(vw|volkswagen)\s*touran\b', 'VW Touran'),
-            (r'\b(vw|volkswagen)\s*sharan\b', 'VW Sharan'),
-            (r'\bseat\s*alhambra\b', 'Seat Alhambra'),
-            (r'\bpeugeot\s*traveller\b', 'Peugeot Traveller'),
-            (r'\bopel\s*combo\b', 'Opel Combo'),
-        ]
-        
-        for pattern, model_name in seven_seater_models:
-            if re.search(pattern, car_lower, re.IGNORECASE):
-                return "M2" if is_auto else "M1"  # 7 Seater
+        if SUV_SEVEN_SEATER_RX.search(car_lower):
+            return "M2" if is_auto else "M1"  # 7 Seater
         
         # Normal SUV logic (só se não for 7 lugares)
         return "L1" if is_auto else "F"
     
     # SUV Automatic / SUV Auto → L1 (mas só se não for exceção acima)
     if cat in ['suv automatic', 'suv auto', 'jeep automatic', 'jeep auto']:
-        import re
         # Verificar TODAS as exceções 7 lugares antes de retornar L1
-        seven_seater_patterns = [
-            r'\bpeugeot\s*5008\b',
-            r'\bcitro[eë]n\s*c4\s*picasso\b',
-            r'\bcitro[eë]n\s*c4\s*(grand\s*picasso|grand\s*spacetourer)\b',
-            r'\brenault\s*(grand\s*)?scenic\b',
-            r'\b(vw|volkswagen)\s*caddy\b',
-            r'\bdacia\s*lodgy\b',
-            r'\bdacia\s*jogger\b',
-            r'\bpeugeot\s*rifter\b',
-            r'\bford\s*s[-\s]?max\b',
-            r'\bford\s*galaxy\b',
-            r'\bopel\s*zafira\b',
-            r'\b(vw|volkswagen)\s*touran\b',
-            r'\b(vw|volkswagen)\s*sharan\b',
-            r'\bseat\s*alhambra\b',
-            r'\bpeugeot\s*traveller\b',
-            r'\bopel\s*combo\b',
-        ]
-        
-        for pattern in seven_seater_patterns:
-            if re.search(pattern, car_lower, re.IGNORECASE):
-                return "M2"  # 7 Seater Auto
+        if SUV_SEVEN_SEATER_RX.search(car_lower):
+            return "M2"  # 7 Seater Auto
         
         return "L1"  # SUV Auto normal
     
@@ -2426,7 +3227,7 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
     # Luxury / Premium → X
     if cat in ['luxury', 'premium', 'luxo']:
         trans_info = f"[{transmission if transmission else 'N/A'}]"
-        logging.info(f"✅ [MAP] Luxury: car='{car_name}' {trans_info}, category='{category}' → grupo 'X'")
+        logging.debug(f"✅ [MAP] Luxury: car='{car_name}' {trans_info}, category='{category}' → grupo 'X'")
         return "X"
     
     # 7 Seater / 7 Seats → M1 ou M2 (se automático)
@@ -2453,34 +3254,12 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
             car_clean = clean_car_name(car_name)
             car_clean_lower = car_clean.lower()
             
-            # Buscar na tabela car_groups
-            with _db_lock:
-                conn = _db_connect()
-                try:
-                    is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
-                    
-                    if is_postgres:
-                        # PostgreSQL
-                        with conn.cursor() as cur:
-                            cur.execute(
-                                "SELECT code FROM car_groups WHERE LOWER(name) = %s OR LOWER(model) = %s",
-                                (car_clean_lower, car_clean_lower)
-                            )
-                            row = cur.fetchone()
-                    else:
-                        # SQLite
-                        row = conn.execute(
-                            "SELECT code FROM car_groups WHERE LOWER(name) = ? OR LOWER(model) = ?",
-                            (car_clean_lower, car_clean_lower)
-                        ).fetchone()
-                    
-                    if row:
-                        # Extrair código do grupo (ex: B1-FIAT500 -> B1)
-                        full_code = row[0]
-                        group_code = full_code.split('-')[0] if '-' in full_code else full_code
-                        return group_code
-                finally:
-                    conn.close()
+            # Buscar na tabela car_groups (carregada uma vez por versão do classificador)
+            full_code = _load_car_group_names().get(car_clean_lower)
+            if full_code:
+                # Extrair código do grupo (ex: B1-FIAT500 -> B1)
+                group_code = full_code.split('-')[0] if '-' in full_code else full_code
+                return group_code
         except Exception as e:
             logging.error(f"Error querying car_groups: {e}")
             pass  # Se falhar, continuar para próxima prioridade
@@ -2542,139 +3321,13 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
             # Modelos B2 genéricos: qualquer mini não identificado acima
             return "B2"
     
-    # Mapeamento direto (TUDO EM LOWERCASE)
+    # Mapeamento direto (CATEGORY_MAP_FALLBACK, TUDO EM LOWERCASE)
     # Suporta INGLÊS (do scraping CarJet) e PORTUGUÊS (do VEHICLES)
-    category_map = {
-        # B1 - Mini 4 Lugares / Mini 4 Doors
-        "mini 4 doors": "B1",
-        "mini 4 seats": "B1",  # Inglês do CarJet
-        "mini 4 portas": "B1",
-        "mini 4 lugares": "B1",
-        
-        # B2 - Mini 5 Lugares / Mini 5 Doors
-        "mini": "B2",
-        "mini 5 doors": "B2",
-        "mini 5 seats": "B2",  # Inglês do CarJet
-        "mini 5 portas": "B2",
-        "mini 5 lugares": "B2",
-        
-        # CATEGORIAS DE FILTRO DO CARJET (frmAgrp)
-        # Quando o usuário aplica filtros na página de resultados do CarJet
-        # 
-        # IMPORTANTE: Estas categorias AMPLAS retornam múltiplos grupos:
-        # - 'MINI' (Small) → pode conter: B1, B2, D, E1, E2
-        # - 'COMP' (Medium) → grupos intermediários
-        # - 'FAMI' (Large) → grupos grandes
-        # - 'SUVS' (SUV) → pode conter: F, J1, L1
-        # - 'VANS' (People Carrier) → pode conter: M1, M2, N
-        # - 'LUXU' (Premium) → pode conter: G (cabrio)
-        # - 'ESTA' (Estate Cars) → pode conter: J2, L2
-        # - 'AUTO' (Automatic) → categoria específica de automáticos (cruzada)
-        # 
-        # O mapeamento individual por carro é feito via:
-        # 1. VEHICLES dictionary (prioritário)
-        # 2. Análise do nome do carro + transmission
-        # 3. Fallback baseado em keywords
-        
-        # D - Economy
-        "economy": "D",
-        "económico": "D",
-        "compact": "D",
-        "compacto": "D",
-        
-        # E1 - Mini Automatic (do VEHICLES: "MINI Auto")
-        "mini automatic": "E1",
-        "mini auto": "E1",
-        "mini automático": "E1",
-        
-        # E2 - Economy Automatic (do VEHICLES: "ECONOMY Auto")
-        "economy automatic": "E2",
-        "economy auto": "E2",
-        "económico automatic": "E2",
-        "económico auto": "E2",
-        "compact automatic": "E2",
-        "compact auto": "E2",
-        
-        # F - SUV
-        "suv": "F",
-        "jeep": "F",
-        
-        # G - Cabrio APENAS (Premium/Luxury → Others)
-        "cabrio": "G",
-        "cabriolet": "G",
-        "convertible": "G",
-        "conversível": "G",
-        
-        # J1 - Crossover (do VEHICLES: "Crossover")
-        "crossover": "J1",
-        
-        # J2 - Estate/Station Wagon
-        "estate/station wagon": "J2",
-        "station wagon": "J2",
-        "estate": "J2",
-        "carrinha": "J2",
-        "sw": "J2",
-        "touring": "J2",
-        
-        # L1 - SUV Automatic
-        "suv automatic": "L1",
-        "suv auto": "L1",
-        "jeep automatic": "L1",
-        "jeep auto": "L1",
-        
-        # L2 - Station Wagon Automatic (do VEHICLES: "Station Wagon Auto")
-        "station wagon automatic": "L2",
-        "station wagon auto": "L2",
-        "estate automatic": "L2",
-        "estate auto": "L2",
-        "carrinha automatic": "L2",
-        "carrinha auto": "L2",
-        "sw automatic": "L2",
-        "sw auto": "L2",
-        
-        # M1 - 7 Seater (do VEHICLES: "7 Lugares")
-        "7 seater": "M1",
-        "7 seats": "M1",  # Inglês do CarJet
-        "7 lugares": "M1",
-        "people carrier": "M1",
-        "mpv": "M1",
-        
-        # M2 - 7 Seater Automatic (do VEHICLES: "7 Lugares Auto")
-        "7 seater automatic": "M2",
-        "7 seater auto": "M2",
-        "7 seats automatic": "M2",  # Inglês do CarJet
-        "7 seats auto": "M2",  # Inglês do CarJet
-        "7 lugares automatic": "M2",
-        "7 lugares auto": "M2",
-        "7 lugares automático": "M2",
-        "mpv automatic": "M2",
-        "mpv auto": "M2",
-        
-        # N - 9 Seater (do VEHICLES: "9 Lugares")
-        "9 seater": "N",
-        "9 seater automatic": "N",
-        "9 seater auto": "N",
-        "9 seats": "N",  # Inglês do CarJet
-        "9 seats automatic": "N",  # Inglês do CarJet
-        "9 seats auto": "N",  # Inglês do CarJet
-        "9 lugares": "N",
-        "9 lugares automatic": "N",
-        "9 lugares auto": "N",
-        "9 lugares automático": "N",
-        "minivan": "N",
-        "van": "N",
-        
-        # X - Luxury
-        "luxury": "X",
-        "premium": "X",
-        "luxo": "X",
-    }
-    
     # Tentar match direto primeiro
-    if cat in category_map:
-        grupo = category_map[cat]
+    if cat in CATEGORY_MAP_FALLBACK:
+        grupo = CATEGORY_MAP_FALLBACK[cat]
         trans_info = f"[{transmission if transmission else 'N/A'}]"
-        logging.info(f"✅ [MAP] SUCESSO (direto): car='{car_name}' {trans_info} → grupo '{grupo}'")
+        logging.debug(f"✅ [MAP] SUCESSO (direto): car='{car_name}' {trans_info} → grupo '{grupo}'")
         return grupo
     
     # FALLBACK: Análise inteligente por palavras-chave
@@ -2684,50 +3337,50 @@ def _map_category_fallback(category: str, car_name: str = "", transmission: str
     
     # Verificar tipo de veículo por palavras-chave
     if '9' in cat or 'minivan' in cat or 'van' in cat:
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo 'N' (9 Seater)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo 'N' (9 Seater)")
         return "N"  # 9 Seater
     
     if '7' in cat or 'mpv' in cat or 'people carrier' in cat:
         grupo = "M2" if is_auto else "M1"
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (7 Seater)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (7 Seater)")
         return grupo  # 7 Seater
     
     if any(word in cat for word in ['sw', 'station', 'wagon', 'estate', 'carrinha', 'touring']):
         grupo = "L2" if is_auto else "J2"
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Station Wagon)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Station Wagon)")
         return grupo  # Station Wagon
     
     if 'crossover' in cat:
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo 'J1' (Crossover)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo 'J1' (Crossover)")
         return "J1"  # Crossover
     
     if any(word in cat for word in ['suv', 'jeep', '4x4', '4wd']):
         grupo = "L1" if is_auto else "F"
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (SUV)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (SUV)")
         return grupo  # SUV
     
     if any(word in cat for word in ['cabrio', 'cabriolet', 'convertible']):
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo 'G' (Cabrio)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo 'G' (Cabrio)")
         return "G"  # Cabrio apenas
     
     if any(word in cat for word in ['premium', 'luxury', 'luxo']):
         trans_tipo = "AUTOMÁTICO" if is_auto else "MANUAL"
-        logging.info(f"✅ [MAP] Luxury (fallback): car='{car_name}' [{trans_tipo}], category='{category}' → grupo 'X'")
+        logging.debug(f"✅ [MAP] Luxury (fallback): car='{car_name}' [{trans_tipo}], category='{category}' → grupo 'X'")
         return "X"
     
     if any(word in cat for word in ['mini', 'small', 'pequeno']):
         # Verificar se é 4 ou 5 lugares pelo nome do carro
         if any(model in car_lower for model in ['fiat 500', 'fiat500', 'peugeot 108', 'c1', 'vw up', 'picanto', 'aygo']):
             grupo = "E1" if is_auto else "B1"
-            logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Mini 4 lugares)")
+            logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Mini 4 lugares)")
             return grupo  # Mini 4 lugares
         grupo = "E1" if is_auto else "B2"
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Mini 5 lugares)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Mini 5 lugares)")
         return grupo  # Mini 5 lugares (default)
     
     if any(word in cat for word in ['economy', 'econom', 'compact', 'compacto']):
         grupo = "E2" if is_auto else "D"
-        logging.info(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Economy)")
+        logging.debug(f"✅ [MAP] SUCESSO (fallback): car='{car_name}' → grupo '{grupo}' (Economy)")
         return grupo  # Economy
     
     # Se chegou aqui, não conseguiu mapear - LOG CRÍTICO
@@ -3043,10 +3696,25 @@ def init_db():
             )
             safe_create_index(conn, "CREATE INDEX IF NOT EXISTS idx_snapshots_q ON price_snapshots(location, days, ts)", "idx_snapshots_q")
             
-            # Tabela para regras automatizadas de preços
-            logging.info("📋 Creating automated_price_rules table (if not exists)...")
-            conn.execute(
-                """
+            # Rollup diário para /api/price-history (preenchido a partir dos snapshots na 1ª vez)
+            if ensure_price_rollup_table:
+                try:
+                    ensure_price_rollup_table(conn)
+                    if conn.execute("SELECT 1 FROM price_snapshot_daily LIMIT 1").fetchone() is None:
+                        written = backfill_price_rollup(conn)
+                        conn.commit()
+                        logging.info(f"📈 price_snapshot_daily backfilled: {written} rows")
+                except Exception as e:
+                    logging.warning(f"Could not prepare price_snapshot_daily: {e}")
+                    try:
+                        conn.rollback()
+                    except:
+                        pass
+            
+            # Tabela para regras automatizadas de preços
+            logging.info("📋 Creating automated_price_rules table (if not exists)...")
+            conn.execute(
+                """
                 CREATE TABLE IF NOT EXISTS automated_price_rules (
                   id INTEGER PRIMARY KEY AUTOINCREMENT,
                   location TEXT NOT NULL,
@@ -3468,31 +4136,155 @@ init_db()
 # ============================================================
 
 def log_to_db(level: str, message: str, module: str = None, function: str = None, line_number: int = None, exception: str = None):
-    """Salvar logs na base de dados em vez de ficheiros"""
+    """Salvar logs na base de dados em vez de ficheiros (escrita em lote pelo _LOG_WRITER)"""
     try:
-        with _db_lock:
-            conn = _db_connect()
-            try:
-                conn.execute(
-                    """
-                    INSERT INTO system_logs (level, message, module, function, line_number, exception)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (level, message, module, function, line_number, exception)
-                )
-                conn.commit()
-            finally:
-                conn.close()
+        _LOG_WRITER.submit("system_logs", (level, message, module, function, line_number, exception))
     except Exception as e:
         # Fallback para print se DB falhar
         print(f"[{level}] {message}", file=sys.stderr, flush=True)
 
+# --- Cache de dados: LRU em processo à frente da tabela cache_data ---
+# Leituras de chaves quentes não tocam na BD. Cada entrada expira no expires_at da linha;
+# entre workers, save_to_cache faz NOTIFY e um listener (LISTEN) invalida as cópias locais.
+# Sem listener ativo (SQLite, ligação em baixo) as entradas vivem no máximo DATA_CACHE_LOCAL_TTL.
+DATA_CACHE_MAX_ENTRIES = max(1, int(os.getenv("DATA_CACHE_MAX_ENTRIES", "2048") or 2048))
+DATA_CACHE_LOCAL_TTL = float(os.getenv("DATA_CACHE_LOCAL_TTL", "30") or 30)
+DATA_CACHE_CHANNEL = "cache_data_invalidate"
+_DATA_CACHE_ABSENT = object()  # chave sem valor na BD (cache negativa)
+_WORKER_ID = f"{os.getpid()}-{secrets.token_hex(3)}"
+
+class _DataCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.listening = False
+        self.generation = 0  # sobe a cada escrita/invalidação; protege read-through concorrente
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = Lock()
+        self.stats = {
+            "hits": 0, "negative_hits": 0, "misses": 0,
+            "evictions": 0, "expirations": 0, "invalidations": 0,
+        }
+
+    def _deadline(self, expires_ts: Optional[float]) -> Optional[float]:
+        local = None if self.listening else time.time() + DATA_CACHE_LOCAL_TTL
+        if expires_ts is None:
+            return local
+        return expires_ts if local is None else min(expires_ts, local)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return False, None
+            value, deadline = entry
+            if deadline is not None and time.time() >= deadline:
+                del self._entries[key]
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats["negative_hits" if value is _DATA_CACHE_ABSENT else "hits"] += 1
+            return True, value
+
+    def put(self, key: str, value: Any, expires_ts: Optional[float], generation: Optional[int] = None):
+        """Guarda a entrada; com generation só guarda se não houve escritas desde a leitura"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if generation is None:
+                self.generation += 1
+            self._entries[key] = (value, self._deadline(expires_ts))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key: Optional[str] = None):
+        with self._lock:
+            self.generation += 1
+            self.stats["invalidations"] += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["negative_hits"] + self.stats["misses"]
+            hits = self.stats["hits"] + self.stats["negative_hits"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "listening": self.listening,
+                "local_ttl_seconds": None if self.listening else DATA_CACHE_LOCAL_TTL,
+            }
+
+_DATA_CACHE = _DataCache(DATA_CACHE_MAX_ENTRIES)
+_data_cache_listener_stop = threading.Event()
+
+def _parse_cache_expiry(expires_at) -> Optional[float]:
+    if not expires_at:
+        return None
+    dt = expires_at if isinstance(expires_at, datetime) else datetime.fromisoformat(str(expires_at))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+def _on_data_cache_note(payload: str):
+    origin, _, key = payload.partition(":")
+    if origin != _WORKER_ID:
+        _DATA_CACHE.invalidate(key or None)
+
+# canal NOTIFY -> handler(payload); outras secções registam aqui os seus canais
+_PG_LISTEN_HANDLERS = {DATA_CACHE_CHANNEL: _on_data_cache_note}
+
+def _data_cache_listener():
+    """LISTEN cache_data_invalidate (+ canais registados): invalida as chaves escritas por outros workers"""
+    import select
+    while not _data_cache_listener_stop.is_set():
+        conn = None
+        try:
+            conn = _db_listen_connection()
+            if conn is None:
+                return
+            for channel in list(_PG_LISTEN_HANDLERS):
+                conn.cursor().execute(f"LISTEN {channel}")
+            # Notificações perdidas enquanto não estava a ouvir: começar do zero
+            _DATA_CACHE.invalidate()
+            _DATA_CACHE.listening = True
+            while not _data_cache_listener_stop.is_set():
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    handler = _PG_LISTEN_HANDLERS.get(note.channel)
+                    if handler is not None:
+                        try:
+                            handler(note.payload or "")
+                        except Exception as e:
+                            logging.warning(f"[DATA CACHE] handler {note.channel}: {e}")
+        except Exception as e:
+            logging.warning(f"[DATA CACHE] listener: {e}")
+        finally:
+            if _DATA_CACHE.listening:
+                _DATA_CACHE.listening = False
+                _DATA_CACHE.invalidate()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        _data_cache_listener_stop.wait(5)
+
 def save_to_cache(key: str, value: str, expires_in_seconds: int = None):
     """Salvar dados em cache na DB em vez de filesystem"""
     try:
         expires_at = None
         if expires_in_seconds:
-            from datetime import datetime, timedelta, timezone
             expires_at = (datetime.now(timezone.utc) + timedelta(seconds=expires_in_seconds)).isoformat()
         
         with _db_lock:
@@ -3505,45 +4297,47 @@ def save_to_cache(key: str, value: str, expires_in_seconds: int = None):
                     """,
                     (key, value, expires_at)
                 )
+                if _USE_NEW_DB and USE_POSTGRES:
+                    # Entregue aos outros workers só no commit
+                    conn.execute("SELECT pg_notify(?, ?)", (DATA_CACHE_CHANNEL, f"{_WORKER_ID}:{key}"))
                 conn.commit()
             finally:
                 conn.close()
+        _DATA_CACHE.put(key, value, _parse_cache_expiry(expires_at))
     except Exception as e:
+        _DATA_CACHE.invalidate(key)
         log_to_db("ERROR", f"Failed to save cache: {str(e)}", "main", "save_to_cache")
 
 def get_from_cache(key: str):
-    """Obter dados do cache na DB"""
+    """Obter dados do cache (memória; BD só em miss)"""
+    found, value = _DATA_CACHE.get(key)
+    if found:
+        return None if value is _DATA_CACHE_ABSENT else value
+    generation = _DATA_CACHE.generation
     try:
         with _db_lock:
             conn = _db_connect()
             try:
-                cursor = conn.execute(
+                row = conn.execute(
                     """
                     SELECT value, expires_at FROM cache_data 
                     WHERE key = ?
                     """,
                     (key,)
-                )
-                row = cursor.fetchone()
-                
-                if row:
-                    value, expires_at = row
-                    
-                    # Verificar expiração
-                    if expires_at:
-                        from datetime import datetime, timezone
-                        expires_dt = datetime.fromisoformat(expires_at)
-                        if datetime.now(timezone.utc) > expires_dt:
-                            # Expirado, deletar
-                            conn.execute("DELETE FROM cache_data WHERE key = ?", (key,))
-                            conn.commit()
-                            return None
-                    
-                    return value
-                
-                return None
+                ).fetchone()
             finally:
                 conn.close()
+        if not row:
+            _DATA_CACHE.put(key, _DATA_CACHE_ABSENT, None, generation)
+            return None
+        value, expires_at = row[0], row[1]
+        expires_ts = _parse_cache_expiry(expires_at)
+        if expires_ts is not None and time.time() > expires_ts:
+            # Expirado: a linha é removida por cleanup_expired_cache, não no caminho de leitura
+            _DATA_CACHE.put(key, _DATA_CACHE_ABSENT, None, generation)
+            return None
+        _DATA_CACHE.put(key, value, expires_ts, generation)
+        return value
     except Exception as e:
         log_to_db("ERROR", f"Failed to get cache: {str(e)}", "main", "get_from_cache")
         return None
@@ -5060,6 +5854,65 @@ async def admin_update_inspection_permissions(request: Request, user_id: int):
     except Exception as e:
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
+@app.get("/api/admin/db-pool-stats")
+async def admin_db_pool_stats(request: Request):
+    """Métricas do pool de ligações à BD (tempo de espera, ligações em uso)"""
+    try:
+        require_admin(request)
+    except HTTPException:
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=403)
+    
+    if not _get_db_pool_stats:
+        return JSONResponse({"ok": False, "error": "Database module not loaded"}, status_code=503)
+    info = _translate_pg_query.cache_info()
+    lookups = info.hits + info.misses
+    return _no_store_json({
+        "ok": True,
+        "pool": _get_db_pool_stats(),
+        "ingest": _get_db_ingest_stats(),
+        "log_writer": _LOG_WRITER.snapshot(),
+        "query_cache": {
+            "database": _get_db_query_cache_stats(),
+            "main": {
+                "hits": info.hits,
+                "misses": info.misses,
+                "size": info.currsize,
+                "max_size": info.maxsize,
+                "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0,
+            },
+        },
+    })
+
+@app.get("/api/admin/cache-stats")
+async def admin_cache_stats(request: Request):
+    """Estatísticas das caches em memória (hits, misses, bytes, evictions)"""
+    try:
+        require_admin(request)
+    except HTTPException:
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=403)
+    
+    return _no_store_json({
+        "ok": True,
+        "prices": _prices_cache_stats(),
+        "vehicle_groups": get_vehicle_classifier_stats(),
+        "images": _img_pool_stats(),
+        "image_variants": _img_variant_stats(),
+        "data": _DATA_CACHE.snapshot(),
+        "vehicle_photos": _VEHICLE_PHOTOS.snapshot(),
+        "damage_pdf": _damage_pdf_stats(),
+        "ra_extract": _ra_extract_stats(),
+    })
+
+@app.get("/api/admin/browser-pool")
+async def admin_browser_pool(request: Request):
+    """Estado do pool Selenium de /api/track-by-params (drivers, fila, tempos por etapa)"""
+    try:
+        require_admin(request)
+    except HTTPException:
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=403)
+    
+    return _no_store_json({"ok": True, **_SELENIUM_POOL.snapshot()})
+
 @app.get("/api/admin/whatsapp/get-config")
 async def admin_get_whatsapp_config(request: Request):
     """Get WhatsApp connection configuration"""
@@ -5306,6 +6159,45 @@ async def shutdown_whatsapp_token_refresher():
             pass
         _whatsapp_token_refresh_task = None
 
+@app.on_event("startup")
+async def startup_data_cache_listener():
+    if _USE_NEW_DB and USE_POSTGRES and _db_listen_connection:
+        _data_cache_listener_stop.clear()
+        threading.Thread(target=_data_cache_listener, name="data-cache-listener", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown_data_cache_listener():
+    _data_cache_listener_stop.set()
+
+@app.on_event("shutdown")
+async def shutdown_whatsapp_ingest():
+    try:
+        await asyncio.to_thread(_WHATSAPP_INGEST.flush)
+    except Exception:
+        pass
+
+@app.on_event("shutdown")
+async def shutdown_log_writer():
+    try:
+        await asyncio.to_thread(_LOG_WRITER.flush)
+    except Exception:
+        pass
+
+@app.on_event("shutdown")
+async def shutdown_image_client():
+    try:
+        await _close_img_client()
+    except Exception:
+        pass
+
+@app.on_event("shutdown")
+async def shutdown_carjet_direct_client():
+    try:
+        from carjet_direct import close_direct_client
+        await close_direct_client()
+    except Exception:
+        pass
+
 @app.post("/api/admin/whatsapp/refresh-token")
 async def refresh_whatsapp_token_endpoint(request: Request):
     require_auth(request)
@@ -5395,6 +6287,7 @@ async def admin_save_whatsapp_config(request: Request):
                                 message_text TEXT,
                                 direction VARCHAR(10) NOT NULL,
                                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                received_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'utc'),
                                 status VARCHAR(20) DEFAULT 'sent',
                                 sender_name TEXT
                             )
@@ -5481,6 +6374,7 @@ async def admin_save_whatsapp_config(request: Request):
                             message_text TEXT,
                             direction TEXT NOT NULL,
                             timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                            received_at TEXT DEFAULT CURRENT_TIMESTAMP,
                             status TEXT DEFAULT 'sent',
                             sender_name TEXT,
                             FOREIGN KEY (conversation_id) REFERENCES whatsapp_conversations(id) ON DELETE CASCADE
@@ -5635,6 +6529,7 @@ async def force_create_whatsapp_tables(request: Request):
                                 message_text TEXT,
                                 direction VARCHAR(10) NOT NULL,
                                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                received_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'utc'),
                                 status VARCHAR(20) DEFAULT 'sent',
                                 sender_name TEXT
                             )
@@ -5730,6 +6625,7 @@ async def force_create_whatsapp_tables(request: Request):
                             message_text TEXT,
                             direction TEXT NOT NULL,
                             timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                            received_at TEXT DEFAULT CURRENT_TIMESTAMP,
                             status TEXT DEFAULT 'sent',
                             sender_name TEXT,
                             FOREIGN KEY (conversation_id) REFERENCES whatsapp_conversations(id) ON DELETE CASCADE
@@ -5931,256 +6827,319 @@ async def cleanup_whatsapp_contact_ids(request: Request):
         traceback.print_exc()
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
+# --- Ingestão do webhook WhatsApp em segundo plano ---
+# O webhook só valida e põe na fila (resposta imediata à Meta, sem BD no pedido).
+# Uma thread junta as mensagens em lotes e faz upsert de contactos/conversas e
+# INSERT das mensagens numa só transação, ignorando ids já gravados (redeliveries).
+WHATSAPP_INGEST_BATCH = max(1, int(os.getenv("WHATSAPP_INGEST_BATCH", "100") or 100))
+WHATSAPP_INGEST_FLUSH_MS = int(os.getenv("WHATSAPP_INGEST_FLUSH_MS", "100") or 100)
+WHATSAPP_INGEST_MAX_PENDING = max(1, int(os.getenv("WHATSAPP_INGEST_MAX_PENDING", "20000") or 20000))
+WHATSAPP_INGEST_MAX_ATTEMPTS = max(1, int(os.getenv("WHATSAPP_INGEST_MAX_ATTEMPTS", "5") or 5))
+WHATSAPP_INGEST_RETRY_SECONDS = float(os.getenv("WHATSAPP_INGEST_RETRY_SECONDS", "2") or 2)
+WHATSAPP_WINDOW_EXPIRED_PREVIEW = '⚠️ Janela de 24h expirou. Use template aprovado.'
+WHATSAPP_MESSAGE_COLUMNS = ("id", "conversation_id", "message_text", "direction", "timestamp", "status", "sender_name")
+
+def _whatsapp_message_content(message: Dict[str, Any]) -> str:
+    message_type = message.get('type', 'text')
+    if message_type == 'text':
+        return message.get('text', {}).get('body', '')
+    elif message_type == 'image':
+        return '[Imagem recebida]'
+    elif message_type == 'document':
+        return '[Documento recebido]'
+    elif message_type == 'audio':
+        return '[Áudio recebido]'
+    return f'[{message_type}]'
+
+def _whatsapp_preview(text: str) -> str:
+    return text[:50] + ('...' if len(text) > 50 else '')
+
+class _WhatsAppIngest:
+    def __init__(self):
+        self._buf: deque = deque()  # (kind, data, enqueued_at, attempts)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._seen: "OrderedDict[str, None]" = OrderedDict()  # ids recentes (redeliveries da Meta)
+        self.stats = {
+            "webhooks": 0, "enqueued": 0, "messages_written": 0, "statuses_applied": 0,
+            "duplicates": 0, "invalid": 0, "dropped": 0, "batches": 0, "errors": 0, "retries": 0,
+            "last_batch_rows": 0, "last_batch_ms": 0.0, "last_lag_ms": 0.0, "max_lag_ms": 0.0,
+        }
+
+    def submit_webhook(self, body: Dict[str, Any]) -> int:
+        """Extrai mensagens/estados do payload da Meta e põe-nos na fila; devolve quantos"""
+        items = []
+        invalid = 0
+        for entry in body.get('entry') or []:
+            for change in entry.get('changes') or []:
+                value = change.get('value') or {}
+                names = {c.get('wa_id'): (c.get('profile') or {}).get('name') for c in value.get('contacts') or []}
+                for message in value.get('messages') or []:
+                    # Validado aqui, um a um: um item mal formado não pode levar o lote inteiro
+                    try:
+                        from_phone = str(message.get('from') or '')
+                        message_id = str(message.get('id') or '')
+                        if not from_phone or not message_id:
+                            continue
+                        items.append(("message", {
+                            "message_id": message_id,
+                            "from_phone": from_phone,
+                            "contact_name": str(names.get(from_phone) or from_phone),
+                            "content": _whatsapp_message_content(message),
+                            "sent_at": datetime.fromtimestamp(int(message.get('timestamp') or time.time())),
+                        }))
+                    except Exception as e:
+                        invalid += 1
+                        print(f"[WHATSAPP-INGEST] invalid message skipped ({e}): {message}", file=sys.stderr, flush=True)
+                for status in value.get('statuses') or []:
+                    if isinstance(status, dict):
+                        items.append(("status", status))
+                    else:
+                        invalid += 1
+        now = time.monotonic()
+        queued = 0
+        with self._cond:
+            self.stats["webhooks"] += 1
+            self.stats["invalid"] += invalid
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="whatsapp-ingest", daemon=True)
+                self._thread.start()
+            for kind, data in items:
+                if kind == "message":
+                    if data["message_id"] in self._seen:
+                        self.stats["duplicates"] += 1
+                        continue
+                    self._seen[data["message_id"]] = None
+                    if len(self._seen) > 4 * WHATSAPP_INGEST_MAX_PENDING:
+                        self._seen.popitem(last=False)
+                if len(self._buf) >= WHATSAPP_INGEST_MAX_PENDING:
+                    self._drop(kind, data, "queue full")
+                    continue
+                self._buf.append((kind, data, now, 0))
+                queued += 1
+            self.stats["enqueued"] += queued
+            if queued:
+                self._cond.notify_all()
+        return queued
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping or self._buf)
+                self._cond.wait_for(lambda: self._stopping or len(self._buf) >= WHATSAPP_INGEST_BATCH,
+                                    timeout=WHATSAPP_INGEST_FLUSH_MS / 1000)
+                batch = [self._buf.popleft() for _ in range(min(len(self._buf), WHATSAPP_INGEST_BATCH))]
+                done = self._stopping and not self._buf
+            failed = batch if batch and not self._write(batch) else []
+            if len(failed) > 1:
+                # Lote recusado: gravar um a um para só os itens que falham sozinhos voltarem à fila
+                failed = [item for item in failed if not self._write([item])]
+            if failed:
+                # BD em baixo: devolve os itens à frente da fila e espera antes de tentar outra vez
+                with self._cond:
+                    for kind, data, enqueued_at, attempts in reversed(failed):
+                        if attempts + 1 >= WHATSAPP_INGEST_MAX_ATTEMPTS:
+                            self._drop(kind, data, "giving up")
+                        else:
+                            self._buf.appendleft((kind, data, enqueued_at, attempts + 1))
+                            self.stats["retries"] += 1
+                    if not self._stopping:
+                        self._cond.wait_for(lambda: self._stopping, timeout=WHATSAPP_INGEST_RETRY_SECONDS)
+                    done = self._stopping and not self._buf
+            if done:
+                return
+
+    def _drop(self, kind: str, data: Dict[str, Any], reason: str):
+        """(com self._cond) Descarta um item; o id sai de _seen para uma redelivery da Meta ainda entrar"""
+        self.stats["dropped"] += 1
+        if kind == "message":
+            self._seen.pop(data["message_id"], None)
+        print(f"[WHATSAPP-INGEST] {reason}, dropped {kind}: {data}", file=sys.stderr, flush=True)
+
+    def _write(self, batch) -> bool:
+        messages = [data for kind, data, _, _ in batch if kind == "message"]
+        statuses = [data for kind, data, _, _ in batch if kind == "status"]
+        t0 = time.perf_counter()
+        try:
+            with _db_lock:
+                con = _db_connect()
+                try:
+                    events, duplicates = self._write_messages(con, messages)
+                    events += self._apply_statuses(con, statuses)
+                    for event in events:
+                        _whatsapp_feed_notify_sql(con, event)
+                    con.commit()
+                except Exception:
+                    try:
+                        con.rollback()
+                    except Exception:
+                        pass
+                    raise
+                finally:
+                    con.close()
+        except Exception as e:
+            with self._cond:
+                self.stats["errors"] += 1
+            print(f"[WHATSAPP-INGEST] batch of {len(batch)} failed: {e}", file=sys.stderr, flush=True)
+            return False
+        for event in events:
+            _WHATSAPP_FEED.publish_threadsafe(event)
+        elapsed = (time.perf_counter() - t0) * 1000
+        lag = (time.monotonic() - min(item[2] for item in batch)) * 1000
+        with self._cond:
+            self.stats["messages_written"] += len(messages) - duplicates
+            self.stats["duplicates"] += duplicates
+            self.stats["statuses_applied"] += len(statuses)
+            self.stats["batches"] += 1
+            self.stats["last_batch_rows"] = len(batch)
+            self.stats["last_batch_ms"] = round(elapsed, 2)
+            self.stats["last_lag_ms"] = round(lag, 2)
+            self.stats["max_lag_ms"] = round(max(self.stats["max_lag_ms"], lag), 2)
+        return True
+
+    def _write_messages(self, con, messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Upsert de contactos e conversas + INSERT das mensagens novas; devolve (eventos, duplicadas)"""
+        if not messages:
+            return [], 0
+        by_id: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        for msg in messages:
+            by_id.setdefault(msg["message_id"], msg)
+        marks = ", ".join("?" for _ in by_id)
+        existing = {row[0] for row in con.execute(f"SELECT id FROM whatsapp_messages WHERE id IN ({marks})", tuple(by_id)).fetchall()}
+        fresh = [msg for message_id, msg in by_id.items() if message_id not in existing]
+        duplicates = len(messages) - len(fresh)
+        if not fresh:
+            return [], duplicates
+
+        # Um registo por telefone: último nome/preview do lote, unread += nº de mensagens
+        phones: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        for msg in fresh:
+            entry = phones.setdefault(msg["from_phone"], {"count": 0})
+            entry["count"] += 1
+            entry["name"] = msg["contact_name"]
+            entry["preview"] = _whatsapp_preview(msg["content"])
+        phone_marks = ", ".join("?" for _ in phones)
+
+        con.execute(
+            "INSERT INTO whatsapp_contacts (name, phone_number, has_whatsapp) VALUES "
+            + ", ".join("(?, ?, ?)" for _ in phones)
+            + " ON CONFLICT (phone_number) DO UPDATE SET name = excluded.name, has_whatsapp = excluded.has_whatsapp",
+            tuple(v for phone, entry in phones.items() for v in (entry["name"], phone, True)),
+        )
+        contact_ids = dict(con.execute(
+            f"SELECT phone_number, id FROM whatsapp_contacts WHERE phone_number IN ({phone_marks})", tuple(phones)
+        ).fetchall())
+
+        con.execute(
+            "INSERT INTO whatsapp_conversations (contact_id, phone_number, last_message_at, last_message_preview, unread_count, status) VALUES "
+            + ", ".join("(?, ?, CURRENT_TIMESTAMP, ?, ?, 'open')" for _ in phones)
+            + """ ON CONFLICT (phone_number) DO UPDATE SET
+                    last_message_at = excluded.last_message_at,
+                    last_message_preview = excluded.last_message_preview,
+                    unread_count = whatsapp_conversations.unread_count + excluded.unread_count,
+                    contact_id = excluded.contact_id""",
+            tuple(v for phone, entry in phones.items() for v in (contact_ids.get(phone), phone, entry["preview"], entry["count"])),
+        )
+        conversation_ids = dict(con.execute(
+            f"SELECT phone_number, id FROM whatsapp_conversations WHERE phone_number IN ({phone_marks})", tuple(phones)
+        ).fetchall())
+
+        rows = [
+            (msg["message_id"], conversation_ids[msg["from_phone"]], msg["content"], 'inbound',
+             msg["sent_at"], 'received', msg["contact_name"])
+            for msg in fresh
+        ]
+        conflict = "ON CONFLICT (id) DO NOTHING"  # outro worker pode ter gravado a mesma redelivery
+        if _bulk_insert_rows:
+            _bulk_insert_rows(con, "whatsapp_messages", WHATSAPP_MESSAGE_COLUMNS, rows, on_conflict=conflict)
+        else:
+            sql = f"INSERT INTO whatsapp_messages ({', '.join(WHATSAPP_MESSAGE_COLUMNS)}) VALUES ({', '.join('?' for _ in WHATSAPP_MESSAGE_COLUMNS)}) {conflict}"
+            for row in rows:
+                con.execute(sql, row)
+
+        print(f"[WHATSAPP-INGEST] ✅ Saved {len(fresh)} messages ({len(phones)} conversations, {duplicates} duplicates)")
+        events = [
+            {"type": "message", "conversation_id": conversation_ids[msg["from_phone"]],
+             "message_id": msg["message_id"], "direction": "inbound"}
+            for msg in fresh
+        ]
+        return events, duplicates
+
+    def _apply_statuses(self, con, statuses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        events = []
+        for status in statuses:
+            status_type = status.get('status')  # sent, delivered, read, failed
+            recipient_id = status.get('recipient_id')
+            events.append({"type": "status", "message_id": status.get('id'),
+                           "status": status_type, "recipient_id": recipient_id})
+            # Handle failed messages (24-hour window error, etc)
+            if status_type != 'failed':
+                continue
+            for error in status.get('errors', []):
+                error_code = error.get('code')
+                print(f"[WHATSAPP-INGEST] ❌ Message FAILED to {recipient_id}")
+                print(f"[WHATSAPP-INGEST] Error {error_code}: {error.get('title')}")
+                print(f"[WHATSAPP-INGEST] Details: {error.get('error_data', {}).get('details', '')}")
+                if error_code == 131047:
+                    # 24h window expired: user must use approved template to re-engage
+                    con.execute("UPDATE whatsapp_conversations SET last_message_preview = ? WHERE phone_number = ?",
+                                (WHATSAPP_WINDOW_EXPIRED_PREVIEW, recipient_id))
+        return events
+
+    def flush(self, timeout: float = 10.0):
+        """Grava tudo o que está na fila e pára a thread (shutdown)"""
+        with self._cond:
+            thread = self._thread
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            oldest = self._buf[0][2] if self._buf else None
+            return {
+                **self.stats,
+                "pending": len(self._buf),
+                "lag_ms": round((time.monotonic() - oldest) * 1000, 2) if oldest is not None else 0.0,
+                "max_pending": WHATSAPP_INGEST_MAX_PENDING,
+                "batch_rows": WHATSAPP_INGEST_BATCH,
+                "flush_ms": WHATSAPP_INGEST_FLUSH_MS,
+                "running": bool(self._thread and self._thread.is_alive()),
+            }
+
+_WHATSAPP_INGEST = _WhatsAppIngest()
+atexit.register(_WHATSAPP_INGEST.flush)
+
 @app.post("/api/whatsapp/webhook")
 async def whatsapp_webhook_receive(request: Request):
-    """WhatsApp webhook - receive incoming messages"""
+    """WhatsApp webhook - valida e põe na fila; a gravação é feita pelo _WHATSAPP_INGEST"""
     try:
-        global whatsapp_conversations, whatsapp_conversation_counter
-        
         body = await request.json()
-        print(f"[WHATSAPP-WEBHOOK] Received webhook: {body}")
-        
-        # Process incoming messages
-        if 'entry' in body:
-            for entry in body['entry']:
-                for change in entry.get('changes', []):
-                    if change.get('value', {}).get('messages'):
-                        for message in change['value']['messages']:
-                            from datetime import datetime
-                            
-                            # Extract message data
-                            from_phone = message.get('from', '')
-                            message_type = message.get('type', 'text')
-                            message_id = message.get('id', '')
-                            timestamp = message.get('timestamp', str(int(datetime.now().timestamp())))
-                            
-                            # Get message content
-                            message_content = ''
-                            if message_type == 'text':
-                                message_content = message.get('text', {}).get('body', '')
-                            elif message_type == 'image':
-                                message_content = '[Imagem recebida]'
-                            elif message_type == 'document':
-                                message_content = '[Documento recebido]'
-                            elif message_type == 'audio':
-                                message_content = '[Áudio recebido]'
-                            else:
-                                message_content = f'[{message_type}]'
-                            
-                            # Get contact info from webhook
-                            contact_name = None
-                            if 'contacts' in change['value']:
-                                for contact in change['value']['contacts']:
-                                    if contact.get('wa_id') == from_phone:
-                                        contact_name = contact.get('profile', {}).get('name', from_phone)
-                                        break
-                            
-                            if not contact_name:
-                                contact_name = from_phone
-                            
-                            print(f"[WHATSAPP-WEBHOOK] Message from {contact_name} ({from_phone}): {message_content}")
-                            
-                            # Save to database
-                            with _db_lock:
-                                conn = _db_connect()
-                                try:
-                                    is_postgres = str(conn.__class__).find('psycopg') >= 0
-                                    
-                                    # STEP 1: Find or create CONTACT first
-                                    contact_id = None
-                                    if is_postgres:
-                                        with conn.cursor() as cur:
-                                            # Try to find existing contact
-                                            cur.execute("SELECT id FROM whatsapp_contacts WHERE phone_number = %s", (from_phone,))
-                                            contact_row = cur.fetchone()
-                                            
-                                            if contact_row:
-                                                contact_id = contact_row[0]
-                                                # Update contact name if provided
-                                                cur.execute("""
-                                                    UPDATE whatsapp_contacts 
-                                                    SET name = %s, has_whatsapp = TRUE
-                                                    WHERE id = %s
-                                                """, (contact_name, contact_id))
-                                                print(f"[WHATSAPP-WEBHOOK] Updated contact #{contact_id}")
-                                            else:
-                                                # Create new contact
-                                                cur.execute("""
-                                                    INSERT INTO whatsapp_contacts (name, phone_number, has_whatsapp)
-                                                    VALUES (%s, %s, TRUE)
-                                                    RETURNING id
-                                                """, (contact_name, from_phone))
-                                                contact_id = cur.fetchone()[0]
-                                                print(f"[WHATSAPP-WEBHOOK] Created new contact #{contact_id}")
-                                        conn.commit()
-                                    else:
-                                        # SQLite version - create contact first
-                                        contact_row = conn.execute("SELECT id FROM whatsapp_contacts WHERE phone_number = ?", (from_phone,)).fetchone()
-                                        
-                                        if contact_row:
-                                            contact_id = contact_row[0]
-                                            # Update contact name if provided
-                                            conn.execute("""
-                                                UPDATE whatsapp_contacts 
-                                                SET name = ?, has_whatsapp = 1
-                                                WHERE id = ?
-                                            """, (contact_name, contact_id))
-                                            print(f"[WHATSAPP-WEBHOOK] Updated contact #{contact_id}")
-                                        else:
-                                            # Create new contact
-                                            cursor = conn.execute("""
-                                                INSERT INTO whatsapp_contacts (name, phone_number, has_whatsapp)
-                                                VALUES (?, ?, 1)
-                                            """, (contact_name, from_phone))
-                                            contact_id = cursor.lastrowid
-                                            print(f"[WHATSAPP-WEBHOOK] Created new contact #{contact_id}")
-                                        conn.commit()
-                                    
-                                    # STEP 2: Find or create CONVERSATION linked to contact
-                                    if is_postgres:
-                                        with conn.cursor() as cur:
-                                            cur.execute("SELECT id FROM whatsapp_conversations WHERE phone_number = %s", (from_phone,))
-                                            conv_row = cur.fetchone()
-                                    else:
-                                        conv_row = conn.execute("SELECT id FROM whatsapp_conversations WHERE phone_number = ?", (from_phone,)).fetchone()
-                                    
-                                    if conv_row:
-                                        conversation_id = conv_row[0]
-                                        print(f"[WHATSAPP-WEBHOOK] Found existing conversation #{conversation_id}")
-                                        
-                                        # Update conversation
-                                        if is_postgres:
-                                            with conn.cursor() as cur:
-                                                cur.execute("""
-                                                    UPDATE whatsapp_conversations 
-                                                    SET last_message_at = CURRENT_TIMESTAMP,
-                                                        last_message_preview = %s,
-                                                        unread_count = unread_count + 1,
-                                                        contact_id = %s
-                                                    WHERE id = %s
-                                                """, (message_content[:50] + ('...' if len(message_content) > 50 else ''), contact_id, conversation_id))
-                                            conn.commit()
-                                        else:
-                                            conn.execute("""
-                                                UPDATE whatsapp_conversations 
-                                                SET last_message_at = CURRENT_TIMESTAMP,
-                                                    last_message_preview = ?,
-                                                    unread_count = unread_count + 1,
-                                                    contact_id = ?
-                                                WHERE id = ?
-                                            """, (message_content[:50] + ('...' if len(message_content) > 50 else ''), contact_id, conversation_id))
-                                            conn.commit()
-                                    else:
-                                        # Create new conversation linked to contact
-                                        if is_postgres:
-                                            with conn.cursor() as cur:
-                                                cur.execute("""
-                                                    INSERT INTO whatsapp_conversations 
-                                                    (contact_id, phone_number, last_message_at, last_message_preview, unread_count, status)
-                                                    VALUES (%s, %s, CURRENT_TIMESTAMP, %s, 1, 'open')
-                                                    RETURNING id
-                                                """, (contact_id, from_phone, message_content[:50] + ('...' if len(message_content) > 50 else '')))
-                                                conversation_id = cur.fetchone()[0]
-                                            conn.commit()
-                                        else:
-                                            cursor = conn.execute("""
-                                                INSERT INTO whatsapp_conversations 
-                                                (contact_id, phone_number, last_message_at, last_message_preview, unread_count, status)
-                                                VALUES (?, ?, datetime('now'), ?, 1, 'open')
-                                            """, (contact_id, from_phone, message_content[:50] + ('...' if len(message_content) > 50 else '')))
-                                            conversation_id = cursor.lastrowid
-                                            conn.commit()
-                                        
-                                        print(f"[WHATSAPP-WEBHOOK] ✅ Created new conversation #{conversation_id} for contact #{contact_id}")
-                                    
-                                    # Insert message into database
-                                    message_timestamp = datetime.fromtimestamp(int(timestamp))
-                                    
-                                    if is_postgres:
-                                        with conn.cursor() as cur:
-                                            cur.execute("""
-                                                INSERT INTO whatsapp_messages 
-                                                (id, conversation_id, message_text, direction, timestamp, status, sender_name)
-                                                VALUES (%s, %s, %s, 'inbound', %s, 'received', %s)
-                                            """, (message_id, conversation_id, message_content, message_timestamp, contact_name))
-                                        conn.commit()
-                                    else:
-                                        conn.execute("""
-                                            INSERT INTO whatsapp_messages 
-                                            (id, conversation_id, message_text, direction, timestamp, status, sender_name)
-                                            VALUES (?, ?, ?, 'inbound', ?, 'received', ?)
-                                        """, (message_id, conversation_id, message_content, message_timestamp, contact_name))
-                                        conn.commit()
-                                    
-                                    print(f"[WHATSAPP-WEBHOOK] ✅ Saved message to database: conversation #{conversation_id}")
-                                    
-                                finally:
-                                    conn.close()
-                    
-                    # Process status updates (delivery status, read receipts, errors)
-                    if change.get('value', {}).get('statuses'):
-                        for status in change['value']['statuses']:
-                            status_type = status.get('status')  # sent, delivered, read, failed
-                            message_id = status.get('id')
-                            recipient_id = status.get('recipient_id')
-                            timestamp = status.get('timestamp')
-                            
-                            # Handle failed messages (24-hour window error, etc)
-                            if status_type == 'failed':
-                                errors = status.get('errors', [])
-                                for error in errors:
-                                    error_code = error.get('code')
-                                    error_title = error.get('title')
-                                    error_message = error.get('message')
-                                    error_details = error.get('error_data', {}).get('details', '')
-                                    
-                                    print(f"[WHATSAPP-WEBHOOK] ❌ Message FAILED to {recipient_id}")
-                                    print(f"[WHATSAPP-WEBHOOK] Error {error_code}: {error_title}")
-                                    print(f"[WHATSAPP-WEBHOOK] Details: {error_details}")
-                                    
-                                    # Special handling for 24-hour window error
-                                    if error_code == 131047:
-                                        print(f"[WHATSAPP-WEBHOOK] 🕐 24-hour window expired for {recipient_id}")
-                                        print(f"[WHATSAPP-WEBHOOK] 💡 User must use approved template to re-engage")
-                                        
-                                        # Update conversation with warning flag
-                                        try:
-                                            with _db_lock:
-                                                conn = _db_connect()
-                                                try:
-                                                    is_postgres = str(conn.__class__).find('psycopg') >= 0
-                                                    
-                                                    if is_postgres:
-                                                        with conn.cursor() as cur:
-                                                            cur.execute("""
-                                                                UPDATE whatsapp_conversations 
-                                                                SET last_message_preview = %s
-                                                                WHERE phone_number = %s
-                                                            """, ('⚠️ Janela de 24h expirou. Use template aprovado.', recipient_id))
-                                                        conn.commit()
-                                                    else:
-                                                        conn.execute("""
-                                                            UPDATE whatsapp_conversations 
-                                                            SET last_message_preview = ?
-                                                            WHERE phone_number = ?
-                                                        """, ('⚠️ Janela de 24h expirou. Use template aprovado.', recipient_id))
-                                                        conn.commit()
-                                                    
-                                                    print(f"[WHATSAPP-WEBHOOK] ✅ Updated conversation with 24h warning")
-                                                finally:
-                                                    conn.close()
-                                        except Exception as e:
-                                            print(f"[WHATSAPP-WEBHOOK] Error updating conversation: {e}")
+        if not isinstance(body, dict):
+            raise ValueError("payload is not a JSON object")
+        queued = _WHATSAPP_INGEST.submit_webhook(body)
+        print(f"[WHATSAPP-WEBHOOK] Received webhook: {queued} item(s) queued")
         
         # Always return 200 to acknowledge receipt
-        return JSONResponse({"status": "received"}, status_code=200)
+        return JSONResponse({"status": "received", "queued": queued}, status_code=200)
     except Exception as e:
         print(f"[WHATSAPP-WEBHOOK] ❌ Error processing message: {str(e)}")
-        import traceback
-        traceback.print_exc()
         # Still return 200 to avoid Meta retrying
         return JSONResponse({"status": "error", "error": str(e)}, status_code=200)
 
+@app.get("/api/admin/whatsapp/ingest-stats")
+async def admin_whatsapp_ingest_stats(request: Request):
+    """Fila do webhook WhatsApp: pendentes, atraso (lag) e lotes gravados"""
+    try:
+        require_admin(request)
+    except HTTPException:
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=403)
+    
+    return _no_store_json({"ok": True, **_WHATSAPP_INGEST.snapshot()})
+
 @app.post("/api/admin/whatsapp/test-connection")
 async def admin_test_whatsapp_connection(request: Request):
     """Test WhatsApp API connection"""
@@ -6345,99 +7304,326 @@ async def set_whatsapp_profile_picture(request: Request, file: UploadFile = File
         traceback.print_exc()
         return JSONResponse({"success": False, "error": str(e)})
 
+# --- Server-Sent Events: formato comum aos streams (WhatsApp, bulk-prices, jobs) ---
+# Sem eventos durante SSE_HEARTBEAT_SECONDS envia-se um comentário ": ping" para
+# proxies não fecharem a ligação e para detetar clientes que se desligaram.
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15") or 15)
+
+def _sse_frame(event: str, payload: Dict[str, Any]) -> str:
+    """Um evento SSE com o payload em JSON"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
 # ============================================================
 # WHATSAPP DASHBOARD ENDPOINTS
 # ============================================================
 
-@app.get("/api/whatsapp/conversations")
-async def get_whatsapp_conversations(request: Request):
-    """Get WhatsApp conversations from database WITH contact data"""
-    require_auth(request)
+# --- Feed incremental: paginação por cursor (keyset) + push por SSE ---
+# A lista de conversas é ordenada por (COALESCE(last_message_at, created_at), id) DESC;
+# o cursor é essa chave da última linha devolvida, codificada em base64. O dashboard
+# pede páginas de WHATSAPP_PAGE_SIZE e depois só os deltas (updated_since=sync_token)
+# quando o /api/whatsapp/stream avisa que algo mudou.
+WHATSAPP_PAGE_SIZE = max(1, int(os.getenv("WHATSAPP_PAGE_SIZE", "50") or 50))
+WHATSAPP_PAGE_MAX = max(WHATSAPP_PAGE_SIZE, int(os.getenv("WHATSAPP_PAGE_MAX", "500") or 500))
+WHATSAPP_FEED_QUEUE = max(8, int(os.getenv("WHATSAPP_FEED_QUEUE", "256") or 256))
+WHATSAPP_FEED_CHANNEL = "whatsapp_feed"
+WHATSAPP_SYNC_OVERLAP = 5.0  # s: deltas de mensagens repetem esta margem (escritas que fizeram commit fora de ordem)
+_WA_CONV_KEY = "COALESCE(conv.last_message_at, conv.created_at)"
+_whatsapp_feed_indexes_ready = False
+
+def _ensure_whatsapp_feed_indexes():
+    """Índices das listas paginadas (uma vez por processo; as tabelas são criadas pelo setup WhatsApp)"""
+    global _whatsapp_feed_indexes_ready
+    if _whatsapp_feed_indexes_ready:
+        return
     try:
-        # Filter by status if provided
-        status = request.query_params.get('status')
-        
         with _db_lock:
             conn = _db_connect()
             try:
-                is_postgres = str(conn.__class__).find('psycopg') >= 0
-                
-                # JOIN with whatsapp_contacts to get contact data
-                if status:
-                    query = """
-                        SELECT conv.id, conv.phone_number, conv.last_message_at, conv.last_message_preview,
-                               conv.unread_count, conv.status, conv.assigned_to,
-                               cont.id as contact_id, cont.name as contact_name, 
-                               cont.has_whatsapp, cont.profile_picture_url
-                        FROM whatsapp_conversations conv
-                        LEFT JOIN whatsapp_contacts cont ON conv.contact_id = cont.id
-                        WHERE conv.status = """ + ("%s" if is_postgres else "?") + """
-                        ORDER BY COALESCE(conv.last_message_at, conv.created_at) DESC
-                    """
-                    if is_postgres:
-                        with conn.cursor() as cur:
-                            cur.execute(query, (status,))
-                            rows = cur.fetchall()
-                    else:
-                        rows = conn.execute(query, (status,)).fetchall()
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_wa_conv_feed ON whatsapp_conversations ((COALESCE(last_message_at, created_at)) DESC, id DESC)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_wa_msg_feed ON whatsapp_messages (conversation_id, timestamp, id)")
+                # received_at: quando a linha foi escrita (UTC). Os deltas de mensagens usam-na:
+                # o timestamp das recebidas é a hora de envio do WhatsApp (reentregas e atraso
+                # da ingestão chegam com timestamps antigos) e as enviadas estão noutro fuso.
+                if isinstance(conn, sqlite3.Connection):
+                    columns = {r[1] for r in conn.execute("PRAGMA table_info(whatsapp_messages)").fetchall()}
+                    if "received_at" not in columns:
+                        # ALTER TABLE do SQLite não aceita DEFAULT CURRENT_TIMESTAMP: trigger
+                        conn.execute("ALTER TABLE whatsapp_messages ADD COLUMN received_at TEXT")
+                    conn.execute("""
+                        CREATE TRIGGER IF NOT EXISTS trg_wa_msg_received_at AFTER INSERT ON whatsapp_messages
+                        WHEN NEW.received_at IS NULL
+                        BEGIN
+                            UPDATE whatsapp_messages SET received_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+                        END
+                    """)
                 else:
-                    # Show all conversations with contact data
-                    query = """
-                        SELECT conv.id, conv.phone_number, conv.last_message_at, conv.last_message_preview,
-                               conv.unread_count, conv.status, conv.assigned_to,
-                               cont.id as contact_id, cont.name as contact_name, 
-                               cont.has_whatsapp, cont.profile_picture_url
-                        FROM whatsapp_conversations conv
-                        LEFT JOIN whatsapp_contacts cont ON conv.contact_id = cont.id
-                        ORDER BY COALESCE(conv.last_message_at, conv.created_at) DESC
-                    """
-                    if is_postgres:
-                        with conn.cursor() as cur:
-                            cur.execute(query)
-                            rows = cur.fetchall()
-                    else:
-                        rows = conn.execute(query).fetchall()
-                
-                conversations = []
-                for row in rows:
-                    # Use contact name if available, fallback to phone
-                    display_name = row[8] if row[8] else row[1]  # contact_name or phone_number
-                    
-                    conversations.append({
-                        "id": row[0],
-                        "name": display_name,
-                        "phone_number": row[1],
-                        "last_message_at": row[2].isoformat() if hasattr(row[2], 'isoformat') else str(row[2]),
-                        "last_message_preview": row[3],
-                        "unread_count": row[4],
-                        "status": row[5],
-                        "assigned_to": row[6],
-                        "contact_id": row[7],  # NEW: contact ID
-                        "has_whatsapp": bool(row[9]) if row[9] is not None else None,
-                        "profile_picture_url": row[10],
-                        "messages": []  # Messages loaded separately
-                    })
-                
-                print(f"[WHATSAPP] Returning {len(conversations)} conversations (with contact data) from database")
-                
-                return JSONResponse({
-                    "ok": True,
-                    "success": True,
-                    "conversations": conversations
-                })
+                    conn.execute("ALTER TABLE whatsapp_messages ADD COLUMN IF NOT EXISTS received_at TIMESTAMP")
+                    conn.execute("ALTER TABLE whatsapp_messages ALTER COLUMN received_at SET DEFAULT (NOW() AT TIME ZONE 'utc')")
+                conn.execute("UPDATE whatsapp_messages SET received_at = timestamp WHERE received_at IS NULL")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_wa_msg_received ON whatsapp_messages (conversation_id, received_at)")
+                conn.commit()
+                _whatsapp_feed_indexes_ready = True
             finally:
                 conn.close()
-                
     except Exception as e:
-        print(f"[WHATSAPP] ❌ Error loading conversations: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return JSONResponse({"ok": False, "success": False, "error": str(e)}, status_code=500)
+        logging.warning(f"[WHATSAPP] Could not create feed indexes: {e}")
 
-@app.post("/api/whatsapp/contacts/verify")
-async def verify_whatsapp_contact(request: Request):
-    """Verify if a phone number has WhatsApp and get profile picture"""
-    require_auth(request)
+def _wa_key_token(value) -> Optional[str]:
+    """Chave de ordenação como texto (datetime no PostgreSQL, texto no SQLite)"""
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+def _wa_since_param(value: Optional[str]) -> Optional[str]:
+    """Normaliza updated_since/sync_token para comparar com colunas TIMESTAMP (PG) ou texto (SQLite)"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError("updated_since inválido")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(" ")
+
+def _wa_encode_cursor(key, row_id) -> str:
+    raw = json.dumps([_wa_key_token(key), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _wa_decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, Any]]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        key, row_id = json.loads(raw)
+        return _wa_since_param(key), row_id
+    except Exception:
+        raise ValueError("cursor inválido")
+
+def _wa_page_limit(request: Request) -> Optional[int]:
+    """limit da query (máx. WHATSAPP_PAGE_MAX); None = sem limite (comportamento antigo)"""
+    raw = request.query_params.get("limit")
+    if raw in (None, ""):
+        return None
+    try:
+        return max(1, min(int(raw), WHATSAPP_PAGE_MAX))
+    except ValueError:
+        raise ValueError("limit inválido")
+
+class _WhatsAppFeed:
+    """Fan-out em processo dos eventos WhatsApp para os clientes SSE ligados a este worker"""
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"published": 0, "remote": 0, "delivered": 0, "overflows": 0, "connections": 0}
+
+    def subscribe(self) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        self.stats["connections"] += 1
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: Dict[str, Any]):
+        """Só no event loop; de outras threads usar publish_threadsafe"""
+        self.stats["published"] += 1
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+                self.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                # Cliente lento: descarta o que tem e pede-lhe para recarregar a lista
+                self.stats["overflows"] += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+
+    def publish_threadsafe(self, event: Dict[str, Any]):
+        loop = self._loop
+        if loop is not None and self._subscribers and not loop.is_closed():
+            loop.call_soon_threadsafe(self.publish, event)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "subscribers": len(self._subscribers)}
+
+_WHATSAPP_FEED = _WhatsAppFeed(WHATSAPP_FEED_QUEUE)
+
+def _on_whatsapp_feed_note(payload: str):
+    origin, _, data = payload.partition(":")
+    if origin == _WORKER_ID or not data:
+        return
+    _WHATSAPP_FEED.stats["remote"] += 1
+    _WHATSAPP_FEED.publish_threadsafe(json.loads(data))
+
+_PG_LISTEN_HANDLERS[WHATSAPP_FEED_CHANNEL] = _on_whatsapp_feed_note
+
+def _whatsapp_feed_notify_sql(conn, event: Dict[str, Any]):
+    """NOTIFY do evento na transação de conn (entregue aos outros workers no commit)"""
+    if not (_USE_NEW_DB and USE_POSTGRES):
+        return
+    payload = f"{_WORKER_ID}:{json.dumps(event, separators=(',', ':'), default=str)}"
+    conn.execute("SELECT pg_notify(?, ?)", (WHATSAPP_FEED_CHANNEL, payload))
+
+def _whatsapp_feed_notify_db(event: Dict[str, Any]):
+    """Leva o evento aos outros workers (NOTIFY; no SQLite só há um processo)"""
+    if not (_USE_NEW_DB and USE_POSTGRES):
+        return
+    try:
+        with _db_lock:
+            conn = _db_connect()
+            try:
+                _whatsapp_feed_notify_sql(conn, event)
+                conn.commit()
+            finally:
+                conn.close()
+    except Exception as e:
+        logging.warning(f"[WHATSAPP] feed notify: {e}")
+
+async def _whatsapp_feed_emit(event: Dict[str, Any]):
+    """Publica um evento (message/status/conversation) para todos os dashboards ligados"""
+    _WHATSAPP_FEED.publish(event)
+    await asyncio.to_thread(_whatsapp_feed_notify_db, event)
+
+@app.get("/api/whatsapp/stream")
+async def whatsapp_feed_stream(request: Request):
+    """Server-Sent Events com as alterações às conversas (substitui o polling do dashboard)
+
+    Os eventos só dizem o que mudou (ids); o cliente vai buscar o delta a
+    /api/whatsapp/conversations?updated_since=... Em cada (re)ligação é enviado
+    'ready' para o cliente apanhar o que perdeu entretanto.
+    """
+    require_auth(request)
+    queue = _WHATSAPP_FEED.subscribe()
+
+    async def _stream():
+        try:
+            yield "retry: 5000\n\n" + _sse_frame("ready", {"worker": _WORKER_ID})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield _sse_frame(event.get("type", "message"), event)
+        finally:
+            _WHATSAPP_FEED.unsubscribe(queue)
+
+    # Content-Encoding: identity -> o GZipMiddleware não fica a acumular os eventos
+    return StreamingResponse(_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no",
+                                      "Content-Encoding": "identity"})
+
+@app.get("/api/whatsapp/conversations")
+async def get_whatsapp_conversations(request: Request):
+    """Get WhatsApp conversations from database WITH contact data
+
+    Sem parâmetros devolve todas (como antes). Com limit=N devolve uma página e
+    next_cursor para a seguinte (cursor=...); com updated_since=<sync_token> só as
+    conversas com mensagens desde esse instante. sync_token vem sempre na resposta.
+    """
+    require_auth(request)
+    # Filter by status if provided
+    status = request.query_params.get('status')
+    try:
+        limit = _wa_page_limit(request)
+        cursor = _wa_decode_cursor(request.query_params.get('cursor'))
+        since = _wa_since_param(request.query_params.get('updated_since'))
+    except ValueError as e:
+        return JSONResponse({"ok": False, "success": False, "error": str(e)}, status_code=400)
+    try:
+        _ensure_whatsapp_feed_indexes()
+        
+        where, params = [], []
+        if status:
+            where.append("conv.status = ?")
+            params.append(status)
+        if since:
+            # >= porque CURRENT_TIMESTAMP tem resolução de 1s; o cliente junta por id
+            where.append(f"{_WA_CONV_KEY} >= ?")
+            params.append(since)
+        if cursor:
+            where.append(f"({_WA_CONV_KEY} < ? OR ({_WA_CONV_KEY} = ? AND conv.id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        
+        # JOIN with whatsapp_contacts to get contact data
+        query = f"""
+            SELECT conv.id, conv.phone_number, conv.last_message_at, conv.last_message_preview,
+                   conv.unread_count, conv.status, conv.assigned_to,
+                   cont.id as contact_id, cont.name as contact_name, 
+                   cont.has_whatsapp, cont.profile_picture_url,
+                   {_WA_CONV_KEY} as sort_key
+            FROM whatsapp_conversations conv
+            LEFT JOIN whatsapp_contacts cont ON conv.contact_id = cont.id
+            {("WHERE " + " AND ".join(where)) if where else ""}
+            ORDER BY {_WA_CONV_KEY} DESC, conv.id DESC
+        """
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit + 1)
+        
+        with _db_lock:
+            conn = _db_connect()
+            try:
+                rows = conn.execute(query, tuple(params)).fetchall()
+            finally:
+                conn.close()
+        
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _wa_encode_cursor(rows[-1][11], rows[-1][0])
+        
+        conversations = []
+        sync_token = since
+        for row in rows:
+            # Use contact name if available, fallback to phone
+            display_name = row[8] if row[8] else row[1]  # contact_name or phone_number
+            
+            conversations.append({
+                "id": row[0],
+                "name": display_name,
+                "phone_number": row[1],
+                "last_message_at": row[2].isoformat() if hasattr(row[2], 'isoformat') else str(row[2]),
+                "last_message_preview": row[3],
+                "unread_count": row[4],
+                "status": row[5],
+                "assigned_to": row[6],
+                "contact_id": row[7],  # NEW: contact ID
+                "has_whatsapp": bool(row[9]) if row[9] is not None else None,
+                "profile_picture_url": row[10],
+                "messages": []  # Messages loaded separately
+            })
+            key = _wa_since_param(_wa_key_token(row[11])) if row[11] is not None else None
+            if key and (sync_token is None or key > sync_token):
+                sync_token = key
+        
+        print(f"[WHATSAPP] Returning {len(conversations)} conversations (with contact data) from database")
+        
+        return JSONResponse({
+            "ok": True,
+            "success": True,
+            "conversations": conversations,
+            "next_cursor": next_cursor,
+            "sync_token": sync_token
+        })
+                
+    except Exception as e:
+        print(f"[WHATSAPP] ❌ Error loading conversations: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse({"ok": False, "success": False, "error": str(e)}, status_code=500)
+
+@app.post("/api/whatsapp/contacts/verify")
+async def verify_whatsapp_contact(request: Request):
+    """Verify if a phone number has WhatsApp and get profile picture"""
+    require_auth(request)
     try:
         data = await request.json()
         phone = data.get('phone_number', '')
@@ -7468,21 +8654,27 @@ async def sync_google_contacts(request: Request):
 
 @app.get("/api/whatsapp/conversations/{conversation_id}/messages")
 async def get_conversation_messages(request: Request, conversation_id: int):
-    """Get messages for a specific conversation from database"""
+    """Get messages for a specific conversation from database
+
+    Sem parâmetros devolve todas, mais antigas primeiro (como antes). Com limit=N
+    devolve as N mais recentes e next_cursor para as anteriores (cursor=...); com
+    updated_since=<sync_token> só as mensagens gravadas desde esse instante (received_at,
+    com WHATSAPP_SYNC_OVERLAP de margem; o cliente junta por id).
+    """
     require_auth(request)
     try:
+        limit = _wa_page_limit(request)
+        cursor = _wa_decode_cursor(request.query_params.get('cursor'))
+        since = _wa_since_param(request.query_params.get('updated_since'))
+    except ValueError as e:
+        return JSONResponse({"ok": False, "success": False, "error": str(e)}, status_code=400)
+    try:
+        _ensure_whatsapp_feed_indexes()
         with _db_lock:
             conn = _db_connect()
             try:
-                is_postgres = str(conn.__class__).find('psycopg') >= 0
-                
                 # Check if conversation exists
-                if is_postgres:
-                    with conn.cursor() as cur:
-                        cur.execute("SELECT id FROM whatsapp_conversations WHERE id = %s", (conversation_id,))
-                        exists = cur.fetchone()
-                else:
-                    exists = conn.execute("SELECT id FROM whatsapp_conversations WHERE id = ?", (conversation_id,)).fetchone()
+                exists = conn.execute("SELECT id FROM whatsapp_conversations WHERE id = ?", (conversation_id,)).fetchone()
                 
                 if not exists:
                     return JSONResponse({
@@ -7492,35 +8684,57 @@ async def get_conversation_messages(request: Request, conversation_id: int):
                     }, status_code=404)
                 
                 # Load messages
-                query = "SELECT id, message_text, direction, timestamp, status, sender_name FROM whatsapp_messages WHERE conversation_id = " + ("%s" if is_postgres else "?") + " ORDER BY timestamp ASC"
-                if is_postgres:
-                    with conn.cursor() as cur:
-                        cur.execute(query, (conversation_id,))
-                        rows = cur.fetchall()
+                where, params = ["conversation_id = ?"], [conversation_id]
+                if since:
+                    where.append("received_at >= ?")
+                    params.append((datetime.fromisoformat(since) - timedelta(seconds=WHATSAPP_SYNC_OVERLAP)).isoformat(" "))
+                if cursor:
+                    where.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+                    params.extend([cursor[0], cursor[0], cursor[1]])
+                query = "SELECT id, message_text, direction, timestamp, status, sender_name, received_at FROM whatsapp_messages WHERE " + " AND ".join(where)
+                if limit:
+                    # Página = as mais recentes; invertida abaixo para manter a ordem ascendente
+                    query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+                    params.append(limit + 1)
                 else:
-                    rows = conn.execute(query, (conversation_id,)).fetchall()
-                
-                messages = [
-                    {
-                        "id": row[0],
-                        "text": row[1],
-                        "direction": row[2],
-                        "timestamp": row[3].isoformat() if hasattr(row[3], 'isoformat') else str(row[3]),
-                        "status": row[4],
-                        "sender": row[5]
-                    }
-                    for row in rows
-                ]
-                
-                print(f"[WHATSAPP] Returning {len(messages)} messages for conversation #{conversation_id}")
-                
-                return JSONResponse({
-                    "ok": True,
-                    "success": True,
-                    "messages": messages
-                })
+                    query += " ORDER BY timestamp ASC, id ASC"
+                rows = conn.execute(query, tuple(params)).fetchall()
             finally:
                 conn.close()
+        
+        next_cursor = None
+        if limit:
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = _wa_encode_cursor(rows[-1][3], rows[-1][0])
+            rows = rows[::-1]
+        
+        messages = [
+            {
+                "id": row[0],
+                "text": row[1],
+                "direction": row[2],
+                "timestamp": row[3].isoformat() if hasattr(row[3], 'isoformat') else str(row[3]),
+                "status": row[4],
+                "sender": row[5]
+            }
+            for row in rows
+        ]
+        sync_token = since
+        for row in rows:
+            key = _wa_since_param(_wa_key_token(row[6])) if row[6] is not None else None
+            if key and (sync_token is None or key > sync_token):
+                sync_token = key
+        
+        print(f"[WHATSAPP] Returning {len(messages)} messages for conversation #{conversation_id}")
+        
+        return JSONResponse({
+            "ok": True,
+            "success": True,
+            "messages": messages,
+            "next_cursor": next_cursor,
+            "sync_token": sync_token
+        })
     except Exception as e:
         print(f"[WHATSAPP] ❌ Error loading messages: {str(e)}")
         import traceback
@@ -8146,6 +9360,7 @@ async def mark_conversation_read(request: Request, conversation_id: int):
                 
                 if updated > 0:
                     print(f"[WHATSAPP] Marked conversation #{conversation_id} as read")
+                    await _whatsapp_feed_emit({"type": "conversation", "conversation_id": conversation_id, "unread_count": 0})
                     return JSONResponse({
                         "ok": True,
                         "success": True,
@@ -9484,25 +10699,24 @@ async def get_prices(request: Request):
     require_auth(request)
     url = request.query_params.get("url") or TARGET_URL
     refresh = str(request.query_params.get("refresh", "")).strip().lower() in ("1","true","yes","on")
-    # Serve from cache if fresh
+    # Serve from cache if fresh; stale entries are served while one background refresh runs
     if not refresh:
-        cached = _cache_get(url)
+        cached, stale = _cache_lookup(url)
         if cached:
-            # also refresh in background to keep fresh
-            asyncio.create_task(_refresh_prices_background(url))
+            if stale:
+                asyncio.create_task(_refresh_prices_background(url))
             return JSONResponse(cached)
     else:
         try:
             # Invalidate cache entry if exists
-            _PRICES_CACHE.pop(url, None)
+            _cache_invalidate(url)
         except Exception:
             pass
-    # If we have stale data (beyond TTL) we could still serve it while refreshing. For simplicity, compute now.
     try:
         # Fast path: direct fetch for CarJet s/b URLs (often returns full list without UI)
         if isinstance(url, str) and ("carjet.com/do/list/" in url) and ("s=" in url) and ("b=" in url):
             try:
-                data_fast = await _compute_prices_for(url)
+                data_fast = await _compute_prices_single_flight(url)
                 fast_items = (data_fast or {}).get("items") or []
                 if fast_items:
                     out = {"ok": True, "items": fast_items}
@@ -9797,7 +11011,7 @@ async def get_prices(request: Request):
                         pass
             except Exception:
                 pass
-        data = await _compute_prices_for(url)
+        data = await _compute_prices_single_flight(url)
         _cache_set(url, data)
         return JSONResponse(data)
     except Exception as e:
@@ -10345,6 +11559,472 @@ def ensure_all_fields(items: List[Dict[str, Any]], defaults: Dict[str, Any]) ->
                 item[key] = value
     return items
 
+# --- Pool de browsers Selenium para /api/track-by-params ---
+# Chrome headless pré-lançado e reutilizado entre pesquisas (cookies, cache e storage limpos a
+# cada uso). Cada driver é reciclado após SELENIUM_POOL_MAX_USES pesquisas, ao fim de
+# SELENIUM_POOL_MAX_AGE segundos ou quando crasha. As pesquisas correm num executor dedicado
+# com uma thread por driver, fora do event loop.
+SELENIUM_POOL_SIZE = max(1, int(os.getenv("SELENIUM_POOL_SIZE", "1") or 1))
+SELENIUM_POOL_MAX_USES = max(1, int(os.getenv("SELENIUM_POOL_MAX_USES", "20") or 20))
+SELENIUM_POOL_MAX_AGE = float(os.getenv("SELENIUM_POOL_MAX_AGE", "1800") or 1800)
+SELENIUM_POOL_PREWARM = str(os.getenv("SELENIUM_POOL_PREWARM", "1")).strip().lower() in ("1", "true", "yes", "on")
+SELENIUM_SEARCH_TIMEOUT = float(os.getenv("SELENIUM_SEARCH_TIMEOUT", "60") or 60)
+SELENIUM_CARJET_URL = "https://www.carjet.com/aluguel-carros/index.htm"
+SELENIUM_DEVICE = {
+    'name': 'iPhone 13 Pro',
+    'ua': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1',
+    'width': 390,
+    'height': 844,
+    'pixelRatio': 3.0
+}
+_SELENIUM_CONSENT_SELECTOR = "[id*=didomi], [class*=didomi], [id*=cookie], [class*=cookie], [id*=consent], [class*=consent]"
+
+def _launch_selenium_driver():
+    """Lança um Chrome headless com emulação mobile e anti-deteção (3 tentativas)"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+    import platform
+    import sys
+
+    chrome_options = Options()
+    system = platform.system()
+
+    # Headless apenas em Linux (Render/Docker)
+    if system == 'Linux':
+        chrome_options.add_argument('--headless=new')  # Novo modo headless (mais estável)
+        chrome_options.add_argument('--disable-gpu')
+        chrome_options.add_argument('--disable-software-rasterizer')
+
+    # Flags essenciais para Docker/Linux
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--disable-extensions')
+    chrome_options.add_argument('--disable-setuid-sandbox')
+    chrome_options.add_argument(f'user-agent={SELENIUM_DEVICE["ua"]}')
+    chrome_options.add_argument(f'--window-size={SELENIUM_DEVICE["width"]},{SELENIUM_DEVICE["height"]}')
+
+    # EMULAÇÃO MOBILE COMPLETA com device específico
+    chrome_options.add_experimental_option("mobileEmulation", {
+        "deviceMetrics": {
+            "width": SELENIUM_DEVICE['width'],
+            "height": SELENIUM_DEVICE['height'],
+            "pixelRatio": SELENIUM_DEVICE['pixelRatio']
+        },
+        "userAgent": SELENIUM_DEVICE['ua']
+    })
+
+    # Anti-deteção
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+
+    if system == 'Darwin':  # macOS
+        if os.path.exists("/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"):
+            chrome_options.binary_location = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+    elif system == 'Linux':  # Linux (Render/Docker)
+        for path in ('/usr/bin/google-chrome-stable', '/usr/bin/google-chrome', '/usr/bin/chromium-browser', '/usr/bin/chromium'):
+            if os.path.exists(path):
+                chrome_options.binary_location = path
+                break
+
+    driver = None
+    last_error = None
+    # Tentativa 1: Chrome do sistema
+    try:
+        driver = webdriver.Chrome(options=chrome_options)
+    except Exception as e:
+        last_error = str(e)
+        print(f"[SELENIUM POOL] ⚠️ Tentativa 1 falhou: {e}", file=sys.stderr, flush=True)
+        # Tentativa 2: ChromeDriverManager
+        try:
+            driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+        except Exception as e2:
+            last_error = str(e2)
+            print(f"[SELENIUM POOL] ❌ Tentativa 2 falhou: {e2}", file=sys.stderr, flush=True)
+            # Tentativa 3: Sem binary_location (autodetecção)
+            try:
+                chrome_options_clean = Options()
+                for arg in chrome_options.arguments:
+                    chrome_options_clean.add_argument(arg)
+                for key, value in chrome_options.experimental_options.items():
+                    chrome_options_clean.add_experimental_option(key, value)
+                driver = webdriver.Chrome(options=chrome_options_clean)
+            except Exception as e3:
+                last_error = str(e3)
+                print(f"[SELENIUM POOL] ❌ Tentativa 3 falhou: {e3}", file=sys.stderr, flush=True)
+    if driver is None:
+        raise Exception(f"Não foi possível iniciar Chrome após 3 tentativas. Último erro: {last_error}")
+
+    # Esconder webdriver em todas as páginas deste driver
+    driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
+        'source': "Object.defineProperty(navigator, 'webdriver', { get: () => undefined });"
+    })
+    driver.set_page_load_timeout(20)  # Igual ao teste manual
+    return driver
+
+class _PooledDriver:
+    __slots__ = ("driver", "uses", "created")
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.created = time.time()
+
+class _SeleniumPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: List[_PooledDriver] = []
+        self._lock = Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queued = 0
+        self._busy = 0
+        self.counters = {
+            "launched": 0, "launch_failures": 0, "searches": 0, "timeouts": 0,
+            "recycled_uses": 0, "recycled_age": 0, "crashed": 0,
+        }
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def record_stage(self, stage: str, seconds: float):
+        with self._lock:
+            st = self.stages.setdefault(stage, {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0})
+            st["count"] += 1
+            st["total"] += seconds
+            st["last"] = seconds
+            st["max"] = max(st["max"], seconds)
+
+    def _executor_for(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="selenium-pool")
+            return self._executor
+
+    def _launch(self) -> _PooledDriver:
+        t0 = time.perf_counter()
+        try:
+            driver = _launch_selenium_driver()
+        except Exception:
+            self._count("launch_failures")
+            raise
+        self._count("launched")
+        self.record_stage("launch", time.perf_counter() - t0)
+        return _PooledDriver(driver)
+
+    @staticmethod
+    def _quit(pd: _PooledDriver):
+        try:
+            pd.driver.quit()
+        except Exception:
+            pass
+
+    def _usable(self, pd: _PooledDriver) -> bool:
+        if time.time() - pd.created > SELENIUM_POOL_MAX_AGE:
+            self._count("recycled_age")
+            return False
+        try:
+            pd.driver.current_url  # ping: falha se o Chrome/chromedriver morreu
+            return True
+        except Exception:
+            self._count("crashed")
+            return False
+
+    def acquire(self) -> _PooledDriver:
+        while True:
+            with self._lock:
+                pd = self._idle.pop() if self._idle else None
+            if pd is None:
+                return self._launch()
+            if self._usable(pd):
+                return pd
+            self._quit(pd)
+
+    def release(self, pd: _PooledDriver, discard: Optional[str] = None):
+        """Devolve o driver ao pool; discard=<contador> fecha-o (crash, timeout)"""
+        pd.uses += 1
+        if discard:
+            self._count(discard)
+            self._quit(pd)
+            return
+        if pd.uses >= SELENIUM_POOL_MAX_USES:
+            self._count("recycled_uses")
+            self._quit(pd)
+            return
+        with self._lock:
+            self._idle.append(pd)
+
+    def warm(self):
+        """Pré-lança drivers até ao tamanho do pool (corre no executor do pool)"""
+        import sys
+        while True:
+            with self._lock:
+                missing = self.size - len(self._idle) - self._busy
+            if missing <= 0:
+                return
+            try:
+                pd = self._launch()
+            except Exception as e:
+                print(f"[SELENIUM POOL] Pré-aquecimento falhou: {e}", file=sys.stderr, flush=True)
+                return
+            with self._lock:
+                self._idle.append(pd)
+
+    async def run(self, fn, *args):
+        """Executa fn(*args) numa thread do pool; a fila conta pesquisas à espera de um driver"""
+        with self._lock:
+            self._queued += 1
+
+        def _job():
+            with self._lock:
+                self._queued -= 1
+                self._busy += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor_for(), _job)
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            executor, self._executor = self._executor, None
+        for pd in idle:
+            self._quit(pd)
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "busy": self._busy,
+                "queued": self._queued,
+                "max_uses": SELENIUM_POOL_MAX_USES,
+                "max_age_seconds": SELENIUM_POOL_MAX_AGE,
+                "idle_uses": [pd.uses for pd in self._idle],
+                "counters": dict(self.counters),
+                "stages": {
+                    name: {
+                        "count": int(st["count"]),
+                        "avg_ms": round(st["total"] / st["count"] * 1000, 1) if st["count"] else 0.0,
+                        "last_ms": round(st["last"] * 1000, 1),
+                        "max_ms": round(st["max"] * 1000, 1),
+                    }
+                    for name, st in self.stages.items()
+                },
+            }
+
+_SELENIUM_POOL = _SeleniumPool(SELENIUM_POOL_SIZE)
+
+def _reject_cookies_if_present(driver) -> bool:
+    """Clica em rejeitar cookies ou remove o banner; True se encontrou o botão"""
+    return bool(driver.execute_script("""
+        const buttons = document.querySelectorAll('button, a, [role="button"]');
+        let found = false;
+        for (let btn of buttons) {
+            const text = btn.textContent.toLowerCase().trim();
+            if (text.includes('rejeitar') || text.includes('recusar') ||
+                text.includes('reject') || text.includes('rechazar') ||
+                text.includes('weiger') || text.includes('afwijzen') ||  // Holandês
+                text.includes('não aceitar') || text.includes('decline')) {
+                btn.click();
+                found = true;
+                break;
+            }
+        }
+        if (!found) {
+            document.querySelectorAll(arguments[0]).forEach(el => el.remove());
+        }
+        document.body.style.overflow = 'auto';
+        return found;
+    """, _SELENIUM_CONSENT_SELECTOR))
+
+def _selenium_carjet_search(carjet_location: str, start_dt: datetime, end_dt: datetime) -> Dict[str, Any]:
+    """Preenche o formulário CarJet num driver do pool e devolve {final_url, html}.
+
+    Corre numa thread do pool. Todas as esperas são condicionais e limitadas pelo
+    orçamento SELENIUM_SEARCH_TIMEOUT; esgotado o orçamento lança TimeoutError.
+    """
+    from selenium.common.exceptions import TimeoutException, WebDriverException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    import sys
+
+    deadline = time.monotonic() + SELENIUM_SEARCH_TIMEOUT
+
+    def budget(cap: float) -> float:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise TimeoutError(f"Selenium excedeu {SELENIUM_SEARCH_TIMEOUT:.0f}s")
+        return min(cap, left)
+
+    def wait_for(cond, cap: float, poll: float = 0.1) -> bool:
+        try:
+            WebDriverWait(driver, budget(cap), poll_frequency=poll).until(cond)
+            return True
+        except TimeoutException:
+            return False
+
+    t0 = time.perf_counter()
+    pd = _SELENIUM_POOL.acquire()
+    driver = pd.driver
+    t0 = _selenium_stage("acquire", t0)
+    discard = None
+    try:
+        # Estado limpo entre pesquisas (anti-deteção + isolamento entre pedidos)
+        driver.delete_all_cookies()
+        try:
+            driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {"origin": "https://www.carjet.com", "storageTypes": "all"})
+        except Exception as e:
+            print(f"[SELENIUM] ⚠️ CDP clear falhou (não crítico): {e}", file=sys.stderr, flush=True)
+        t0 = _selenium_stage("reset", t0)
+
+        driver.get(SELENIUM_CARJET_URL)
+        # O banner de cookies aparece logo a seguir ao load; esperar por ele em vez de sleep fixo
+        wait_for(lambda d: d.execute_script("return !!document.querySelector(arguments[0])", _SELENIUM_CONSENT_SELECTOR), 2.0)
+        if _reject_cookies_if_present(driver):
+            print(f"[SELENIUM] ✅ Cookies rejeitados", file=sys.stderr, flush=True)
+        t0 = _selenium_stage("home", t0)
+
+        # Se estiver em inglês, usar nomes em inglês
+        page_url = driver.current_url
+        if '/index.htm' in page_url and '/aluguel-carros/' not in page_url and '/aluguer-carros/' not in page_url:
+            if carjet_location == 'Albufeira Cidade':
+                carjet_location = 'Albufeira City'
+            elif carjet_location == 'Faro Aeroporto':
+                carjet_location = 'Faro Airport'
+            print(f"[SELENIUM] Página em INGLÊS, local ajustado para: {carjet_location}", file=sys.stderr, flush=True)
+
+        try:
+            # ORDEM CORRETA DO TESTE: LOCAL → DROPDOWN → DATAS
+            pickup_input = WebDriverWait(driver, budget(10)).until(
+                EC.presence_of_element_located((By.ID, "pickup"))
+            )
+            pickup_input.clear()
+            pickup_input.send_keys(carjet_location)
+
+            if wait_for(EC.element_to_be_clickable((By.CSS_SELECTOR, "#recogida_lista li:first-child a")), 6.0):
+                driver.find_element(By.CSS_SELECTOR, "#recogida_lista li:first-child a").click()
+            else:
+                driver.execute_script("""
+                    const items = document.querySelectorAll('#recogida_lista li');
+                    for (let item of items) {
+                        if (item.offsetParent !== null) {
+                            item.click();
+                            return true;
+                        }
+                    }
+                """)
+            # Dropdown fecha depois da seleção
+            wait_for(EC.invisibility_of_element_located((By.CSS_SELECTOR, "#recogida_lista li")), 2.0)
+
+            result = driver.execute_script("""
+                function fill(sel, val) {
+                    const el = document.querySelector(sel);
+                    if (el) {
+                        el.value = val;
+                        el.dispatchEvent(new Event('input', {bubbles: true}));
+                        el.dispatchEvent(new Event('change', {bubbles: true}));
+                        el.dispatchEvent(new Event('blur', {bubbles: true}));  // ← IGUAL AO TESTE!
+                        return true;
+                    }
+                    return false;
+                }
+                function pick(sel, val) {
+                    const el = document.querySelector(sel);
+                    if (!el) return false;
+                    el.value = val;
+                    el.dispatchEvent(new Event('change', {bubbles: true}));
+                    return true;
+                }
+                const r1 = fill('input[id="fechaRecogida"]', arguments[0]);
+                const r2 = fill('input[id="fechaDevolucion"]', arguments[1]);
+                const h1 = pick('select[id="fechaRecogidaSelHour"]', arguments[2]);
+                const h2 = pick('select[id="fechaDevolucionSelHour"]', arguments[3]);
+                return {fechaRecogida: r1, fechaDevolucion: r2, horaRecogida: h1, horaDevolucion: h2, allFilled: r1 && r2 && h1 && h2};
+            """, start_dt.strftime("%d/%m/%Y"), end_dt.strftime("%d/%m/%Y"), start_dt.strftime("%H:%M"), start_dt.strftime("%H:%M"))
+            print(f"[SELENIUM] ✓ Datas e horas preenchidas: {result}", file=sys.stderr, flush=True)
+        except TimeoutError:
+            raise
+        except WebDriverException as e:
+            print(f"[SELENIUM] Erro ao preencher: {e}", file=sys.stderr, flush=True)
+        t0 = _selenium_stage("form", t0)
+
+        driver.execute_script("window.scrollBy(0, 300);")
+        driver.execute_script("window.scrollTo(0, 0);")
+        driver.execute_script("document.querySelector('form').submit();")
+
+        # Aguardar até que a URL contenha /do/list/ com s= e b= (resultado final)
+        def _on_results(d):
+            u = d.current_url
+            return '/do/list/' in u and 's=' in u and 'b=' in u
+        reached = wait_for(_on_results, 40.0, poll=0.25)
+        t0 = _selenium_stage("submit", t0)
+        if reached:
+            # Conteúdo pronto quando os cartões de resultado existem
+            wait_for(lambda d: d.execute_script("return document.readyState") == "complete"
+                     and d.find_elements(By.CSS_SELECTOR, RESULT_CARD_SELECTOR), 10.0, poll=0.25)
+            t0 = _selenium_stage("results", t0)
+
+        final_url = driver.current_url
+        print(f"[SELENIUM] URL final: {final_url}", file=sys.stderr, flush=True)
+        try:
+            with open(DEBUG_DIR / f"selenium_url_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt", 'w') as f:
+                f.write(f"Final URL: {final_url}\n")
+                f.write(f"Has s=: {'s=' in final_url}\n")
+                f.write(f"Has b=: {'b=' in final_url}\n")
+        except Exception:
+            pass
+        html = driver.page_source if ('s=' in final_url and 'b=' in final_url) else None
+        return {"final_url": final_url, "html": html}
+    except TimeoutError:
+        # Página possivelmente ainda a carregar: não devolver este driver ao pool
+        discard = "timeouts"
+        raise
+    except WebDriverException:
+        discard = "crashed"
+        raise
+    finally:
+        _SELENIUM_POOL._count("searches")
+        _SELENIUM_POOL.release(pd, discard=discard)
+
+def _selenium_stage(stage: str, t0: float) -> float:
+    now = time.perf_counter()
+    _SELENIUM_POOL.record_stage(stage, now - t0)
+    return now
+
+@app.on_event("startup")
+async def startup_selenium_pool():
+    if not SELENIUM_POOL_PREWARM or TEST_MODE_LOCAL == 2:
+        return
+    try:
+        asyncio.get_running_loop().run_in_executor(_SELENIUM_POOL._executor_for(), _SELENIUM_POOL.warm)
+    except Exception as e:
+        logging.warning(f"[SELENIUM POOL] Pré-aquecimento não iniciado: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_selenium_pool():
+    try:
+        await asyncio.to_thread(_SELENIUM_POOL.shutdown)
+    except Exception:
+        pass
+
+async def _scheduler_track_search(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Runner da fila do automated_scheduler: mesmo pipeline que /api/track-by-params"""
+    resp = await _track_by_params_run(payload)
+    return json.loads(resp.body)
+
 @app.post("/api/track-by-params")
 async def track_by_params(request: Request):
     try:
@@ -10356,6 +12036,10 @@ async def track_by_params(request: Request):
         body = await request.json()
     except Exception:
         body = {}
+    return await _track_by_params_run(body)
+
+async def _track_by_params_run(body: Dict[str, Any]):
+    """Pipeline de /api/track-by-params sem o pedido HTTP (usado também pela fila do scheduler)"""
     location = str(body.get("location") or "").strip()
     start_date = str(body.get("start_date") or "").strip()
     start_time = str(body.get("start_time") or "15:00").strip() or "15:00"  # Default 15:00 (consistente com rotação)
@@ -10942,13 +12626,13 @@ async def track_by_params(request: Request):
         if not items:
             try:
                 print("[API] 🔵 Tentando método 1: try_direct_carjet (requests/urllib)", file=sys.stderr, flush=True)
-                html_direct = try_direct_carjet(location, start_dt, end_dt, lang=lang, currency=currency)
+                html_direct = await asyncio.to_thread(try_direct_carjet, location, start_dt, end_dt, lang=lang, currency=currency)
                 
                 if html_direct and len(html_direct) > 100:
                     print(f"[API] ✅ try_direct_carjet retornou HTML: {len(html_direct)} bytes", file=sys.stderr, flush=True)
                     
                     # Parse HTML
-                    items = parse_prices(html_direct, f"https://www.carjet.com/do/list/{lang}")
+                    items = await asyncio.to_thread(parse_prices, html_direct, f"https://www.carjet.com/do/list/{lang}")
                     print(f"[API] Parsed {len(items)} items antes conversão", file=sys.stderr, flush=True)
                     
                     # Converter GBP para EUR
@@ -10992,7 +12676,6 @@ async def track_by_params(request: Request):
             print(f"[PLAYWRIGHT] Iniciando scraping com Playwright (iPhone 13 Pro)...", file=sys.stderr, flush=True)
             try:
                 from playwright.async_api import async_playwright
-                import asyncio
                 
                 # Mapear location para código CarJet
                 location_codes = {
@@ -11224,521 +12907,75 @@ async def track_by_params(request: Request):
                 traceback.print_exc()
         
         # FALLBACK 2: Selenium como último recurso
-        # Código Selenium ATIVO - com rotação multi-idioma e anti-deteção
+        # Driver do pool (pré-lançado) numa thread dedicada - não bloqueia o event loop
         print(f"[SELENIUM] Tentando Selenium como último fallback...", file=sys.stderr, flush=True)
+        def empty_response(**extra):
+            return _no_store_json({
+                "ok": True,
+                "items": [],
+                "location": location,
+                "start_date": start_dt.date().isoformat(),
+                "start_time": start_dt.strftime("%H:%M"),
+                "end_date": end_dt.date().isoformat(),
+                "end_time": end_dt.strftime("%H:%M"),
+                "days": days,
+                **extra,
+            })
         try:
-            from selenium import webdriver
-            from selenium.webdriver.chrome.options import Options
-            from selenium.webdriver.chrome.service import Service
-            from webdriver_manager.chrome import ChromeDriverManager
-            from selenium.webdriver.common.by import By
-            from selenium.webdriver.support.ui import WebDriverWait
-            from selenium.webdriver.support import expected_conditions as EC
-            import time
-            
-            # ============================================
-            # ROTAÇÃO MULTI-IDIOMA (6 idiomas - Holandês removido por problemas)
             # ========== FORÇAR PORTUGUÊS (IGUAL AO TESTE) ==========
-            lang = 'pt'  # Forçar português
-            selected_language = {
-                'name': 'Português',
-                'url': 'https://www.carjet.com/aluguel-carros/index.htm',
-                'faro': 'Faro Aeroporto (FAO)',
-                'albufeira': 'Albufeira Cidade'
-            }
-            
-            # Mapear location para formato CarJet
+            lang = 'pt'
             carjet_location = location
             if 'faro' in location.lower():
-                carjet_location = selected_language['faro']
+                carjet_location = 'Faro Aeroporto (FAO)'
             elif 'albufeira' in location.lower():
-                carjet_location = selected_language['albufeira']
-            
-            carjet_url = selected_language['url']
-            
-            print(f"[SELENIUM] Idioma: {selected_language['name']} (FIXO - igual ao teste)", file=sys.stderr, flush=True)
-            print(f"[SELENIUM] URL: {carjet_url}", file=sys.stderr, flush=True)
-            print(f"[SELENIUM] Local: {carjet_location}", file=sys.stderr, flush=True)
-            
-            # ============================================
+                carjet_location = 'Albufeira Cidade'
+            print(f"[SELENIUM] Local: {carjet_location} | Device: {SELENIUM_DEVICE['name']}", file=sys.stderr, flush=True)
+
             # ROTAÇÃO DE DATAS (0-4 dias aleatório)
-            # ============================================
-            # random já importado globalmente
-            from datetime import timedelta as td
-            
-            # Adicionar offset aleatório de 0-4 dias às datas
             date_offset = random.randint(0, 4)
-            start_dt = start_dt + td(days=date_offset)
-            end_dt = end_dt + td(days=date_offset)
-            
-            print(f"[SELENIUM] Offset de datas: +{date_offset} dias", file=sys.stderr, flush=True)
-            print(f"[SELENIUM] Datas ajustadas: {start_dt.date()} - {end_dt.date()}", file=sys.stderr, flush=True)
-            
-            # ============================================
-            # ROTAÇÃO DE HORAS (14:30-17:00 aleatório)
-            # ============================================
-            # Horas disponíveis no Carjet (de 30 em 30 minutos)
+            start_dt = start_dt + timedelta(days=date_offset)
+            end_dt = end_dt + timedelta(days=date_offset)
+
+            # ROTAÇÃO DE HORAS (14:30-17:00 aleatório, de 30 em 30 minutos no Carjet)
             available_hours = ['14:30', '15:00', '15:30', '16:00', '16:30', '17:00']
             selected_hour = random.choice(available_hours)
-            
-            # Ajustar start_dt e end_dt para usar a hora selecionada
-            start_dt = start_dt.replace(hour=int(selected_hour.split(':')[0]), minute=int(selected_hour.split(':')[1]))
-            end_dt = end_dt.replace(hour=int(selected_hour.split(':')[0]), minute=int(selected_hour.split(':')[1]))
-            
-            print(f"[SELENIUM] Hora selecionada: {selected_hour}", file=sys.stderr, flush=True)
-            
-            # ============================================
-            # FORÇAR DEVICE E REFERRER IGUAIS AO TESTE
-            # ============================================
-            
-            selected_device = {
-                'name': 'iPhone 13 Pro',
-                'ua': 'Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.0 Mobile/15E148 Safari/604.1',
-                'width': 390,
-                'height': 844,
-                'pixelRatio': 3.0
-            }
-            
-            selected_timezone = 'Europe/Lisbon'
-            selected_referrer = ''  # SEM REFERRER (igual ao teste)
-            
-            print(f"[SELENIUM] Device: {selected_device['name']}", file=sys.stderr, flush=True)
-            print(f"[SELENIUM] Timezone: {selected_timezone}", file=sys.stderr, flush=True)
-            print(f"[SELENIUM] Language: {selected_language['name']}", file=sys.stderr, flush=True)
-            print(f"[SELENIUM] Referrer: {selected_referrer if selected_referrer else 'Direct'}", file=sys.stderr, flush=True)
-            
-            chrome_options = Options()
-            
-            # Detectar sistema operacional para configurar headless
-            import platform
-            system = platform.system()
-            
-            # Headless apenas em Linux (Render/Docker)
-            if system == 'Linux':
-                chrome_options.add_argument('--headless=new')  # Novo modo headless (mais estável)
-                chrome_options.add_argument('--disable-gpu')
-                chrome_options.add_argument('--disable-software-rasterizer')
-                print(f"[SELENIUM] Modo headless ativado (Linux)", file=sys.stderr, flush=True)
-            else:
-                print(f"[SELENIUM] Modo visual (não-headless) em {system}", file=sys.stderr, flush=True)
-            
-            # Flags essenciais para Docker/Linux
-            chrome_options.add_argument('--no-sandbox')
-            chrome_options.add_argument('--disable-dev-shm-usage')
-            chrome_options.add_argument('--disable-extensions')
-            chrome_options.add_argument('--disable-setuid-sandbox')
-            chrome_options.add_argument(f'user-agent={selected_device["ua"]}')
-            
-            # Window size (necessário em headless)
-            chrome_options.add_argument(f'--window-size={selected_device["width"]},{selected_device["height"]}')
-            
-            # EMULAÇÃO MOBILE COMPLETA com device específico
-            mobile_emulation = {
-                "deviceMetrics": { 
-                    "width": selected_device['width'], 
-                    "height": selected_device['height'], 
-                    "pixelRatio": selected_device['pixelRatio']
-                },
-                "userAgent": selected_device['ua']
-            }
-            chrome_options.add_experimental_option("mobileEmulation", mobile_emulation)
-            
-            # Anti-deteção
-            chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-            chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            chrome_options.add_experimental_option('useAutomationExtension', False)
-            
-            # Preferências mínimas (IGUAL AO TESTE - sem bloquear cookies!)
-            # NÃO bloquear cookies - pode fazer CarJet comportar-se diferente!
-            # chrome_options.add_experimental_option("prefs", {
-            #     "intl.accept_languages": selected_lang,
-            # })
-            
-            # Definir caminho do Chrome baseado no sistema
-            if system == 'Darwin':  # macOS
-                if os.path.exists("/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"):
-                    chrome_options.binary_location = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
-                    print(f"[SELENIUM] Chrome encontrado em: {chrome_options.binary_location}", file=sys.stderr, flush=True)
-            elif system == 'Linux':  # Linux (Render/Docker)
-                # Tentar múltiplos caminhos possíveis no Linux
-                linux_chrome_paths = [
-                    '/usr/bin/google-chrome-stable',
-                    '/usr/bin/google-chrome',
-                    '/usr/bin/chromium-browser',
-                    '/usr/bin/chromium',
-                ]
-                for path in linux_chrome_paths:
-                    if os.path.exists(path):
-                        chrome_options.binary_location = path
-                        print(f"[SELENIUM] Chrome encontrado em: {path}", file=sys.stderr, flush=True)
-                        break
-                else:
-                    print(f"[SELENIUM] Chrome não encontrado em caminhos padrão, deixando Selenium autodetectar", file=sys.stderr, flush=True)
-            
-            # Iniciar driver com múltiplas tentativas
-            driver = None
-            last_error = None
-            
-            # Tentativa 1: Chrome do sistema
+            hh, mm = (int(x) for x in selected_hour.split(':'))
+            start_dt = start_dt.replace(hour=hh, minute=mm)
+            end_dt = end_dt.replace(hour=hh, minute=mm)
+            print(f"[SELENIUM] Offset de datas: +{date_offset} dias | {start_dt.date()} - {end_dt.date()} | Hora: {selected_hour}", file=sys.stderr, flush=True)
+
             try:
-                print(f"[SELENIUM] Tentativa 1: Chrome do sistema...", file=sys.stderr, flush=True)
-                driver = webdriver.Chrome(options=chrome_options)
-                print(f"[SELENIUM] ✅ Chrome iniciado com sucesso!", file=sys.stderr, flush=True)
+                result = await _SELENIUM_POOL.run(_selenium_carjet_search, carjet_location, start_dt, end_dt)
+            except TimeoutError as e:
+                print(f"[SELENIUM TIMEOUT] ⏰ Ficou preso! {e}", file=sys.stderr, flush=True)
+                return empty_response(warning="Timeout: Scraping ficou preso e foi abortado")
             except Exception as e:
-                last_error = str(e)
-                print(f"[SELENIUM] ⚠️ Tentativa 1 falhou: {e}", file=sys.stderr, flush=True)
-                
-                # Tentativa 2: ChromeDriverManager
-                try:
-                    print(f"[SELENIUM] Tentativa 2: ChromeDriverManager...", file=sys.stderr, flush=True)
-                    driver = webdriver.Chrome(
-                        service=Service(ChromeDriverManager().install()),
-                        options=chrome_options
-                    )
-                    print(f"[SELENIUM] ✅ Chrome iniciado via ChromeDriverManager!", file=sys.stderr, flush=True)
-                except Exception as e2:
-                    last_error = str(e2)
-                    print(f"[SELENIUM] ❌ Tentativa 2 falhou: {e2}", file=sys.stderr, flush=True)
-                    
-                    # Tentativa 3: Sem binary_location (autodetecção)
-                    try:
-                        print(f"[SELENIUM] Tentativa 3: Autodetecção (sem binary_location)...", file=sys.stderr, flush=True)
-                        chrome_options_clean = Options()
-                        # Copiar todos os argumentos mas sem binary_location
-                        for arg in chrome_options.arguments:
-                            chrome_options_clean.add_argument(arg)
-                        for key, value in chrome_options.experimental_options.items():
-                            chrome_options_clean.add_experimental_option(key, value)
-                        
-                        driver = webdriver.Chrome(options=chrome_options_clean)
-                        print(f"[SELENIUM] ✅ Chrome iniciado via autodetecção!", file=sys.stderr, flush=True)
-                    except Exception as e3:
-                        last_error = str(e3)
-                        print(f"[SELENIUM] ❌ Tentativa 3 falhou: {e3}", file=sys.stderr, flush=True)
-            
-            # Se nenhuma tentativa funcionou, lançar erro
-            if driver is None:
-                raise Exception(f"Não foi possível iniciar Chrome após 3 tentativas. Último erro: {last_error}")
-            
-            # FUNÇÃO HELPER: Autodetectar e REJEITAR cookies (mais simples!)
-            def reject_cookies_if_present(step_name=""):
-                """Detecta e REJEITA cookies automaticamente. Retorna True se encontrou cookies."""
-                try:
-                    result = driver.execute_script("""
-                        // Procurar e clicar no botão de REJEITAR cookies
-                        const buttons = document.querySelectorAll('button, a, [role="button"]');
-                        let found = false;
-                        for (let btn of buttons) {
-                            const text = btn.textContent.toLowerCase().trim();
-                            // Procurar por "rejeitar", "recusar", "reject", etc.
-                            if (text.includes('rejeitar') || text.includes('recusar') || 
-                                text.includes('reject') || text.includes('rechazar') ||
-                                text.includes('weiger') || text.includes('afwijzen') ||  // Holandês
-                                text.includes('não aceitar') || text.includes('decline')) {
-                                btn.click();
-                                console.log('✓ Cookies rejeitados:', btn.textContent);
-                                found = true;
-                                break;
-                            }
-                        }
-                        // Se não encontrou botão de rejeitar, tentar fechar/remover o banner
-                        if (!found) {
-                            document.querySelectorAll('[id*=cookie], [class*=cookie], [id*=didomi], [class*=didomi], [id*=consent], [class*=consent]').forEach(el => {
-                                el.remove();
-                            });
-                        }
-                        document.body.style.overflow = 'auto';
-                        return found;
-                    """)
-                    if result:
-                        print(f"[SELENIUM] ✓ Cookies rejeitados {step_name}", file=sys.stderr, flush=True)
-                    else:
-                        print(f"[SELENIUM] ℹ️  Banner removido {step_name}", file=sys.stderr, flush=True)
-                    return result
-                except Exception as e:
-                    print(f"[SELENIUM] ⚠ Erro ao verificar cookies {step_name}: {e}", file=sys.stderr, flush=True)
-                    return False
-            
-            # TIMEOUT GLOBAL: Se ficar preso mais de 60 segundos, abortar
-            import signal
-            def timeout_handler(signum, frame):
-                raise TimeoutError("Selenium ficou preso por mais de 60 segundos!")
-            
-            # Configurar timeout (apenas em sistemas Unix)
-            try:
-                signal.signal(signal.SIGALRM, timeout_handler)
-                signal.alarm(60)  # 60 segundos de timeout
-            except:
-                pass  # Windows não suporta SIGALRM
-            
-            try:
-                # Esconder webdriver
-                driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
-                    'source': '''
-                        Object.defineProperty(navigator, 'webdriver', {
-                            get: () => undefined
-                        });
-                    '''
-                })
-                
-                print(f"[SELENIUM] Configurando Chrome com mobile UA...", file=sys.stderr, flush=True)
-                driver.set_page_load_timeout(20)  # Igual ao teste manual
-                
-                # LIMPAR CACHE E COOKIES (anti-detecção + fresh state)
-                print(f"[SELENIUM] Limpando cache e cookies...", file=sys.stderr, flush=True)
-                driver.delete_all_cookies()
-                try:
-                    # Limpar cache via Chrome DevTools Protocol
-                    driver.execute_cdp_cmd('Network.clearBrowserCache', {})
-                    driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
-                    print(f"[SELENIUM] ✓ Cache e cookies limpos via CDP", file=sys.stderr, flush=True)
-                except Exception as e:
-                    print(f"[SELENIUM] ⚠️ CDP clear falhou (não crítico): {e}", file=sys.stderr, flush=True)
-                
-                # Definir referrer se não for direct
-                if selected_referrer:
-                    print(f"[SELENIUM] Definindo referrer...", file=sys.stderr, flush=True)
-                    driver.execute_cdp_cmd('Network.setExtraHTTPHeaders', {
-                        'headers': {'Referer': selected_referrer}
-                    })
-                
-                print(f"[SELENIUM] Acessando CarJet ({selected_language['name']})...", file=sys.stderr, flush=True)
-                driver.get(carjet_url)
-                
-                # Rejeitar cookies (IGUAL AO TESTE)
-                time.sleep(0.5)
-                if reject_cookies_if_present(""):
-                    print(f"[SELENIUM] ✅ Cookies rejeitados", file=sys.stderr, flush=True)
-                time.sleep(0.5)
-                
-                # DETECTAR IDIOMA e ajustar nome da localização
-                page_url = driver.current_url
-                print(f"[SELENIUM] URL atual: {page_url}", file=sys.stderr, flush=True)
-                
-                # Se estiver em inglês, usar nomes em inglês
-                if '/index.htm' in page_url and '/aluguel-carros/' not in page_url and '/aluguer-carros/' not in page_url:
-                    print(f"[SELENIUM] Página em INGLÊS detectada!", file=sys.stderr, flush=True)
-                    if carjet_location == 'Albufeira Cidade':
-                        carjet_location = 'Albufeira City'
-                    elif carjet_location == 'Faro Aeroporto':
-                        carjet_location = 'Faro Airport'
-                    print(f"[SELENIUM] Local ajustado para: {carjet_location}", file=sys.stderr, flush=True)
-                
-                try:
-                    # ========== ORDEM CORRETA DO TESTE: LOCAL → DROPDOWN → DATAS ==========
-                    
-                    # PASSO 1: Escrever local (IGUAL AO TESTE)
-                    print(f"[SELENIUM] PASSO 1: Escrevendo local...", file=sys.stderr, flush=True)
-                    pickup_input = WebDriverWait(driver, 10).until(
-                        EC.presence_of_element_located((By.ID, "pickup"))
-                    )
-                    pickup_input.clear()
-                    pickup_input.send_keys(carjet_location)
-                    print(f"[SELENIUM] ✓ Local digitado", file=sys.stderr, flush=True)
-                    
-                    # PASSO 2: Aguardar dropdown e clicar
-                    print(f"[SELENIUM] PASSO 2: Aguardando dropdown...", file=sys.stderr, flush=True)
-                    time.sleep(3)
-                    
-                    try:
-                        dropdown_item = WebDriverWait(driver, 3).until(
-                            EC.element_to_be_clickable((By.CSS_SELECTOR, "#recogida_lista li:first-child a"))
-                        )
-                        dropdown_item.click()
-                        print(f"[SELENIUM] ✓ Dropdown clicado", file=sys.stderr, flush=True)
-                    except:
-                        driver.execute_script("""
-                            const items = document.querySelectorAll('#recogida_lista li');
-                            for (let item of items) {
-                                if (item.offsetParent !== null) {
-                                    item.click();
-                                    return true;
-                                }
-                            }
-                        """)
-                        print(f"[SELENIUM] ✓ Dropdown clicado (JS)", file=sys.stderr, flush=True)
-                    
-                    time.sleep(1)
-                    
-                    # PASSO 3: Preencher datas e horas (DEPOIS do dropdown!)
-                    print(f"[SELENIUM] PASSO 3: Preenchendo datas e horas...", file=sys.stderr, flush=True)
-                    
-                    result = driver.execute_script("""
-                        function fill(sel, val) {
-                            const el = document.querySelector(sel);
-                            if (el) { 
-                                el.value = val; 
-                                el.dispatchEvent(new Event('input', {bubbles: true}));
-                                el.dispatchEvent(new Event('change', {bubbles: true}));
-                                el.dispatchEvent(new Event('blur', {bubbles: true}));  // ← IGUAL AO TESTE!
-                                console.log('Preenchido:', sel, '=', val);
-                                return true;
-                            }
-                            console.error('Não encontrado:', sel);
-                            return false;
-                        }
-                        
-                        // Preencher datas
-                        const r1 = fill('input[id="fechaRecogida"]', arguments[0]);
-                        const r2 = fill('input[id="fechaDevolucion"]', arguments[1]);
-                        
-                        // Preencher horas
-                        const h1 = document.querySelector('select[id="fechaRecogidaSelHour"]');
-                        let h1_ok = false;
-                        if (h1) { 
-                            h1.value = arguments[2]; 
-                            h1.dispatchEvent(new Event('change', {bubbles: true}));
-                            console.log('Hora recolha:', h1.value);
-                            h1_ok = true;
-                        }
-                        
-                        const h2 = document.querySelector('select[id="fechaDevolucionSelHour"]');
-                        let h2_ok = false;
-                        if (h2) { 
-                            h2.value = arguments[3]; 
-                            h2.dispatchEvent(new Event('change', {bubbles: true}));
-                            console.log('Hora devolução:', h2.value);
-                            h2_ok = true;
-                        }
-                        
-                        return {
-                            fechaRecogida: r1,
-                            fechaDevolucion: r2,
-                            horaRecogida: h1_ok,
-                            horaDevolucion: h2_ok,
-                            allFilled: r1 && r2 && h1_ok && h2_ok
-                        };
-                    """, start_dt.strftime("%d/%m/%Y"), end_dt.strftime("%d/%m/%Y"), start_dt.strftime("%H:%M"), start_dt.strftime("%H:%M"))
-                    
-                    print(f"[SELENIUM] ✓ Datas e horas preenchidas: {result}", file=sys.stderr, flush=True)
-                    
-                except Exception as e:
-                    print(f"[SELENIUM] Erro ao preencher: {e}", file=sys.stderr, flush=True)
-                
-                # PASSO 4: Submit (IGUAL AO TESTE)
-                print(f"[SELENIUM] PASSO 4: Submetendo...", file=sys.stderr, flush=True)
-                driver.execute_script("window.scrollBy(0, 300);")
-                time.sleep(0.5)
-                driver.execute_script("window.scrollTo(0, 0);")
-                time.sleep(0.5)
-                driver.execute_script("document.querySelector('form').submit();")
-                
-                print(f"[SELENIUM] Aguardando navegação inicial...", file=sys.stderr, flush=True)
-                time.sleep(3)
-                
-                # Aguardar até que a URL contenha /do/list/ (resultado final)
-                print(f"[SELENIUM] Aguardando página de resultados...", file=sys.stderr, flush=True)
-                max_wait = 40  # 40 segundos máximo
-                waited = 0
-                while waited < max_wait:
-                    current_url = driver.current_url
-                    if '/do/list/' in current_url and 's=' in current_url and 'b=' in current_url:
-                        print(f"[SELENIUM] ✅ Página de resultados carregada após {waited}s", file=sys.stderr, flush=True)
-                        break
-                    else:
-                        print(f"[SELENIUM] Aguardando... URL atual: {current_url[:80]}... ({waited}s)", file=sys.stderr, flush=True)
-                        time.sleep(3)
-                        waited += 3
-                
-                # Aguardar mais um pouco para garantir que o conteúdo carregou
-                print(f"[SELENIUM] Aguardando conteúdo carregar...", file=sys.stderr, flush=True)
-                time.sleep(5)
-                
-                final_url = driver.current_url
-                
-                # DEBUG: Salvar URL e HTML para análise
-                try:
-                    import sys
-                    print(f"[SELENIUM] URL final: {final_url}", file=sys.stderr, flush=True)
-                    with open(DEBUG_DIR / f"selenium_url_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt", 'w') as f:
-                        f.write(f"Final URL: {final_url}\n")
-                        f.write(f"Has s=: {'s=' in final_url}\n")
-                        f.write(f"Has b=: {'b=' in final_url}\n")
-                except:
-                    pass
-                
-                # NÃO fazer retry com war= - aceitar o resultado como está
-                # O retry pode causar cliques extras e bagunçar o formulário
-                if 'war=' in final_url:
-                    print(f"[SELENIUM] ⚠️ war= detectado (sem disponibilidade ou erro)", file=sys.stderr, flush=True)
-                
-                # Se obtivemos URL s/b válida, pegar HTML do driver ANTES de fechar
-                if 's=' in final_url and 'b=' in final_url:
-                    print(f"[SELENIUM] ✅ URL s/b obtida! Pegando HTML do driver...", file=sys.stderr, flush=True)
-                    
-                    # Usar page_source do driver em vez de fazer novo request
-                    html_content = driver.page_source
-                    
-                    # Agora pode fechar o driver
-                    driver.quit()
-                    
-                    print(f"[SELENIUM] Fazendo parse de {len(html_content)} bytes...", file=sys.stderr, flush=True)
-                    items = parse_prices(html_content, final_url)
-                    print(f"[SELENIUM] Parsed {len(items)} items", file=sys.stderr, flush=True)
-                    items = convert_items_gbp_to_eur(items)
-                    print(f"[SELENIUM] {len(items)} após GBP→EUR", file=sys.stderr, flush=True)
-                    items = apply_price_adjustments(items, final_url)
-                    print(f"[SELENIUM] {len(items)} após ajustes", file=sys.stderr, flush=True)
-                    
-                    if items:
-                        print(f"[SELENIUM] ✅ {len(items)} carros encontrados!", file=sys.stderr, flush=True)
-                        # APLICAR NORMALIZE_AND_SORT para adicionar campo 'group'
-                        items = normalize_and_sort(items, supplier_priority=None)
-                        # FILTRAR APENAS AUTOMÁTICOS
-                        items = filter_automatic_only(items)
-                        # SUCESSO! Retornar resultados
-                        return _no_store_json({
-                            "ok": True,
-                            "items": items,
-                            "location": location,
-                            "start_date": start_dt.date().isoformat(),
-                            "start_time": start_dt.strftime("%H:%M"),
-                            "end_date": end_dt.date().isoformat(),
-                            "end_time": end_dt.strftime("%H:%M"),
-                            "days": days,
-                        })
-                else:
-                    print(f"[SELENIUM] ⚠️ URL s/b NÃO obtida! URL: {final_url}", file=sys.stderr, flush=True)
-                    driver.quit()
-                    # Fallback: tentar POST direto para /do/list/{lang}
-                    try:
-                        import requests
-                        payload = build_carjet_form(location, start_dt, end_dt, lang=lang, currency=currency)
-                        headers_dp = {
-                            "Origin": "https://www.carjet.com",
-                            "Referer": f"https://www.carjet.com/do/list/{lang}",
-                            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-                            "Accept-Language": "pt-PT,pt;q=0.9,en;q=0.6",
-                            "Cookie": "monedaForzada=EUR; moneda=EUR; currency=EUR; country=PT; idioma=PT; lang=pt",
-                        }
-                        rdp = requests.post(f"https://www.carjet.com/do/list/{lang}", data=payload, headers=headers_dp, timeout=20)
-                        if rdp.status_code == 200 and (rdp.text or '').strip():
-                            html_dp = rdp.text
-                            its_dp = parse_prices(html_dp, f"https://www.carjet.com/do/list/{lang}")
-                            its_dp = convert_items_gbp_to_eur(its_dp)
-                            its_dp = apply_price_adjustments(its_dp, f"https://www.carjet.com/do/list/{lang}")
-                            if its_dp:
-                                print(f"[SELENIUM] ✅ Fallback POST retornou {len(its_dp)} carros", file=sys.stderr, flush=True)
-                                # APLICAR NORMALIZE_AND_SORT para adicionar campo 'group'
-                                its_dp = normalize_and_sort(its_dp, supplier_priority=None)
-                                # FILTRAR APENAS AUTOMÁTICOS
-                                its_dp = filter_automatic_only(its_dp)
-                                return _no_store_json({
-                                    "ok": True,
-                                    "items": its_dp,
-                                    "location": location,
-                                    "start_date": start_dt.date().isoformat(),
-                                    "start_time": start_dt.strftime("%H:%M"),
-                                    "end_date": end_dt.date().isoformat(),
-                                    "end_time": end_dt.strftime("%H:%M"),
-                                    "days": days,
-                                })
-                    except Exception as _e:
-                        print(f"[SELENIUM] Fallback POST erro: {_e}", file=sys.stderr, flush=True)
-                    # Se ainda sem resultados, retornar vazio rapidamente para permitir nova tentativa
+                print(f"[SELENIUM ERROR interno] {e}", file=sys.stderr, flush=True)
+                return empty_response()
+
+            final_url = result["final_url"]
+            html_content = result["html"]
+            if 'war=' in final_url:
+                print(f"[SELENIUM] ⚠️ war= detectado (sem disponibilidade ou erro)", file=sys.stderr, flush=True)
+
+            if html_content:
+                print(f"[SELENIUM] Fazendo parse de {len(html_content)} bytes...", file=sys.stderr, flush=True)
+                t_parse = time.perf_counter()
+                items = await asyncio.to_thread(parse_prices, html_content, final_url)
+                _SELENIUM_POOL.record_stage("parse", time.perf_counter() - t_parse)
+                print(f"[SELENIUM] Parsed {len(items)} items", file=sys.stderr, flush=True)
+                items = convert_items_gbp_to_eur(items)
+                items = apply_price_adjustments(items, final_url)
+
+                if items:
+                    print(f"[SELENIUM] ✅ {len(items)} carros encontrados!", file=sys.stderr, flush=True)
+                    # APLICAR NORMALIZE_AND_SORT para adicionar campo 'group'
+                    items = normalize_and_sort(items, supplier_priority=None)
+                    # FILTRAR APENAS AUTOMÁTICOS
+                    items = filter_automatic_only(items)
                     return _no_store_json({
                         "ok": True,
-                        "items": [],
+                        "items": items,
                         "location": location,
                         "start_date": start_dt.date().isoformat(),
                         "start_time": start_dt.strftime("%H:%M"),
@@ -11746,72 +12983,51 @@ async def track_by_params(request: Request):
                         "end_time": end_dt.strftime("%H:%M"),
                         "days": days,
                     })
-            except TimeoutError as e:
-                print(f"[SELENIUM TIMEOUT] ⏰ Ficou preso! {e}", file=sys.stderr, flush=True)
-                print(f"[SELENIUM TIMEOUT] Fechando Chrome e abortando...", file=sys.stderr, flush=True)
-                try:
-                    driver.quit()
-                except:
-                    pass
-                # Cancelar alarm
-                try:
-                    signal.alarm(0)
-                except:
-                    pass
-                # RETORNAR vazio em caso de timeout
-                return _no_store_json({
-                    "ok": True,
-                    "items": [],
-                    "location": location,
-                    "start_date": start_dt.date().isoformat(),
-                    "start_time": start_dt.strftime("%H:%M"),
-                    "end_date": end_dt.date().isoformat(),
-                    "end_time": end_dt.strftime("%H:%M"),
-                    "days": days,
-                    "warning": "Timeout: Scraping ficou preso e foi abortado"
-                })
-            except Exception as e:
-                print(f"[SELENIUM ERROR interno] {e}", file=sys.stderr, flush=True)
-                try:
-                    driver.quit()
-                except:
-                    pass
-                # Cancelar alarm
+            else:
+                print(f"[SELENIUM] ⚠️ URL s/b NÃO obtida! URL: {final_url}", file=sys.stderr, flush=True)
+                # Fallback: tentar POST direto para /do/list/{lang}
                 try:
-                    signal.alarm(0)
-                except:
-                    pass
-                # RETORNAR vazio em caso de erro também
-                return _no_store_json({
-                    "ok": True,
-                    "items": [],
-                    "location": location,
-                    "start_date": start_dt.date().isoformat(),
-                    "start_time": start_dt.strftime("%H:%M"),
-                    "end_date": end_dt.date().isoformat(),
-                    "end_time": end_dt.strftime("%H:%M"),
-                    "days": days,
-                })
+                    import requests
+                    payload = build_carjet_form(location, start_dt, end_dt, lang=lang, currency=currency)
+                    headers_dp = {
+                        "Origin": "https://www.carjet.com",
+                        "Referer": f"https://www.carjet.com/do/list/{lang}",
+                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+                        "Accept-Language": "pt-PT,pt;q=0.9,en;q=0.6",
+                        "Cookie": "monedaForzada=EUR; moneda=EUR; currency=EUR; country=PT; idioma=PT; lang=pt",
+                    }
+                    rdp = await asyncio.to_thread(requests.post, f"https://www.carjet.com/do/list/{lang}", data=payload, headers=headers_dp, timeout=20)
+                    if rdp.status_code == 200 and (rdp.text or '').strip():
+                        html_dp = rdp.text
+                        its_dp = await asyncio.to_thread(parse_prices, html_dp, f"https://www.carjet.com/do/list/{lang}")
+                        its_dp = convert_items_gbp_to_eur(its_dp)
+                        its_dp = apply_price_adjustments(its_dp, f"https://www.carjet.com/do/list/{lang}")
+                        if its_dp:
+                            print(f"[SELENIUM] ✅ Fallback POST retornou {len(its_dp)} carros", file=sys.stderr, flush=True)
+                            # APLICAR NORMALIZE_AND_SORT para adicionar campo 'group'
+                            its_dp = normalize_and_sort(its_dp, supplier_priority=None)
+                            # FILTRAR APENAS AUTOMÁTICOS
+                            its_dp = filter_automatic_only(its_dp)
+                            return _no_store_json({
+                                "ok": True,
+                                "items": its_dp,
+                                "location": location,
+                                "start_date": start_dt.date().isoformat(),
+                                "start_time": start_dt.strftime("%H:%M"),
+                                "end_date": end_dt.date().isoformat(),
+                                "end_time": end_dt.strftime("%H:%M"),
+                                "days": days,
+                            })
+                except Exception as _e:
+                    print(f"[SELENIUM] Fallback POST erro: {_e}", file=sys.stderr, flush=True)
+                # Se ainda sem resultados, retornar vazio rapidamente para permitir nova tentativa
+                return empty_response()
         except Exception as e:
             print(f"[SELENIUM ERROR] {e}", file=sys.stderr, flush=True)
             import traceback
             traceback.print_exc(file=sys.stderr)
-            # Cancelar alarm
-            try:
-                signal.alarm(0)
-            except:
-                pass
             # RETORNAR vazio para não travar
-            return _no_store_json({
-                "ok": True,
-                "items": [],
-                "location": location,
-                "start_date": start_dt.date().isoformat(),
-                "start_time": start_dt.strftime("%H:%M"),
-                "end_date": end_dt.date().isoformat(),
-                "end_time": end_dt.strftime("%H:%M"),
-                "days": days,
-            })
+            return empty_response()
         
         # FIM DO CÓDIGO SELENIUM
         
@@ -12480,10 +13696,10 @@ async def img_lookup(car: str):
             "iiurlwidth": "480",
             "origin": "*",
         }
-        r = requests.get(api, params=params, timeout=10, headers={"User-Agent": "PriceTracker/1.0"})
+        r = await _img_request("GET", api, params=params, timeout=10.0)
         url = None
         mime = None
-        if r.ok:
+        if r.is_success:
             data = r.json()
             pages = (data.get("query", {}) or {}).get("pages", {})
             for _, pg in pages.items():
@@ -12493,12 +13709,12 @@ async def img_lookup(car: str):
                 if url:
                     break
         if url:
-            ir = requests.get(url, timeout=10, headers={"User-Agent": "PriceTracker/1.0"})
-            if ir.ok and ir.content:
+            ir = await _img_request("GET", url, timeout=10.0)
+            if ir.is_success and ir.content:
                 ext = ".jpg"
                 if (mime or "").endswith("png"): ext = ".png"
                 elif (mime or "").endswith("webp"): ext = ".webp"
-                path = _save_cache_image(key, ir.content, ext)
+                path = await asyncio.to_thread(_save_cache_image, key, ir.content, ext)
                 resp = Response(content=ir.content, media_type=mime or "image/jpeg")
                 resp.headers["Cache-Control"] = "public, max-age=86400"
                 return resp
@@ -12661,7 +13877,6 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
     if html and "<!--CARJET_REQUESTS_DATA-->" in html:
         try:
             import json
-            import sys
             print("[PARSE] 🔵 Detectado dados do carjet_requests (método novo)", file=sys.stderr, flush=True)
             
             # Extrair JSON embutido
@@ -12677,7 +13892,6 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             return items
         
         except Exception as e:
-            import sys
             print(f"[PARSE] ⚠️ Erro ao extrair JSON: {e}, usando parse HTML normal", file=sys.stderr, flush=True)
             import traceback
             traceback.print_exc(file=sys.stderr)
@@ -12692,11 +13906,20 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
         _page_text = ""
 
     # Helper: detect automatic transmission markers from name or card text or explicit label
+    # (the same page/card text is checked dozens of times per card, so results are memoized)
+    _auto_memo: Dict[str, bool] = {}
+
+    def _has_auto_marker(text: str) -> bool:
+        hit = _auto_memo.get(text)
+        if hit is None:
+            hit = _auto_memo[text] = bool(AUTO_RX.search(text))
+        return hit
+
     def _is_auto_flag(name_lc: str, card_text_lc: str, trans_label: str) -> bool:
         try:
             if (trans_label or '').lower() == 'automatic':
                 return True
-            return bool(AUTO_RX.search(name_lc or '') or AUTO_RX.search(card_text_lc or ''))
+            return _has_auto_marker(name_lc or '') or _has_auto_marker(card_text_lc or '')
         except Exception:
             return False
 
@@ -12745,32 +13968,8 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
         if n in _blocked_norm:
             return True
         # Regex-based strong match on key LUXURY model families (NÃO bloquear electric/hybrid!)
-        patterns = [
-            r"\bmercedes\s+s\s*class\b",
-            r"\bmercedes\s+cla\b",
-            r"\bmercedes\s+cle\b",
-            r"\bmercedes\s+a\s*class\b",
-            r"\bmercedes\s+c\s*class\b",
-            r"\bmercedes\s+e\s*class\b",
-            r"\bmercedes\s+gla\b",
-            r"\bbmw\s+1\s*series\b",
-            r"\bbmw\s+2\s*series\b",
-            r"\bbmw\s+3\s*series\b",
-            r"\bbmw\s+5\s*series\b",
-            r"\bbmw\s*x1\b",
-            r"\bvolvo\s+v60\b",
-            r"\bvolvo\s+xc40\b",
-            r"\bvolvo\s+xc60\b",
-            r"\bvolvo\s+ex30\b",
-            r"\btesla\s+model\s*3\b",
-            r"\bmg\s+zs\b",
-            r"\bmazda\s+mx5\b",
-            r"\bvolkswagen\s+t-roc\b",
-        ]
-        import re as _re
-        for p in patterns:
-            if _re.search(p, n):
-                return True
+        if BLOCKED_MODEL_RX.search(n):
+            return True
         # also check if any blocked long phrase is contained in name
         for b in _blocked_norm:
             if len(b) >= 6 and b in n:
@@ -12838,7 +14037,12 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
         s = " ".join(s.split())
         return s
 
+    # Fotos encontradas neste parse: gravadas numa só transação no fim da passagem pelos cards
+    _pending_photos: Dict[str, str] = {}
+
     def _cache_get_photo(key: str) -> str:
+        if key in _pending_photos:
+            return _pending_photos[key]
         conn = _get_conn()
         if not conn:
             return ""
@@ -12857,18 +14061,25 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
     def _cache_set_photo(key: str, url: str):
         if not (key and url):
             return
+        _pending_photos[key] = url
+
+    def _flush_photo_cache():
+        if not _pending_photos:
+            return
         _init_photos_table()
         conn = _get_conn()
         if not conn:
             return
         try:
             from datetime import datetime as _dt
-            conn.execute(
+            now = _dt.utcnow().isoformat(timespec="seconds")
+            conn.executemany(
                 "INSERT INTO car_images (model_key, photo_url, updated_at) VALUES (?, ?, ?) "
                 "ON CONFLICT(model_key) DO UPDATE SET photo_url=excluded.photo_url, updated_at=excluded.updated_at",
-                (key, url, _dt.utcnow().isoformat(timespec="seconds"))
+                [(key, url, now) for key, url in _pending_photos.items()]
             )
             conn.commit()
+            _pending_photos.clear()
         except Exception:
             pass
         finally:
@@ -12945,10 +14156,16 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             return g
         return g
 
+    # One pass over the tree for the transmission radio, the used-filters box and the result cards
+    try:
+        _trans_input, _filter_used, _result_cards = _scan_result_page(soup)
+    except Exception:
+        _trans_input, _filter_used, _result_cards = None, None, []
+
     # Transmission label from global radio (if present)
     transmission_label = ""
     try:
-        t_inp = soup.select_one("input[name='frmTrans'][checked]")
+        t_inp = _trans_input
         if t_inp and t_inp.has_attr("value"):
             v = (t_inp.get("value") or "").lower()
             if v == "au":
@@ -12962,7 +14179,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
     # Fallback: infer from 'Filtros utilizados anteriormente' section
     if not transmission_label:
         try:
-            used = soup.select_one("#filterUsed")
+            used = _filter_used
             if used:
                 txt = used.get_text(" ", strip=True).lower()
                 if "autom" in txt:
@@ -13138,7 +14355,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
 
     # Pass 2: try to parse explicit car cards/rows from the HTML (preferred over regex)
     try:
-        cards = soup.select("section.newcarlist article, .newcarlist article, article.car, li.result, li.car, .car-item, .result-row")
+        cards = _result_cards
         print(f"[PARSE] Found {len(cards)} cards to parse")
         idx = 0
         cards_with_price = 0
@@ -13146,6 +14363,8 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
         cards_blocked = 0
         for card in cards:
             print(f"🔍 [CARD-START] Processando card {idx+1}/{len(cards)}...", file=sys.stderr, flush=True)
+            # primeiro nó de cada seletor do card (preço, nome, fornecedor, foto, transmissão, categoria, link)
+            card_fields = _scan_card(card)
             # price - PRIORIZAR .price.pr-euros (preço total em euros, NÃO libras nem por dia)
             price_text = ""
             
@@ -13176,7 +14395,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             
             # 2ª PRIORIDADE: Se não encontrou .pr-euros, usar seletor genérico (fallback)
             if not price_text:
-                let_price = card.select_one(".price, .amount, [class*='price'], .nfoPriceDest, .nfoPrice, [data-price]")
+                let_price = card_fields["price"]
                 price_text = (let_price.get_text(strip=True) if let_price else "") or (card.get("data-price") or "")
             
             if not price_text:
@@ -13185,9 +14404,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             print(f"   ✅ [CARD-PRICE] Preço encontrado: {price_text}", file=sys.stderr, flush=True)
             cards_with_price += 1
             # car/model
-            name_el = card.select_one(
-                ".veh-name, .vehicle-name, .model, .titleCar, .title, h3, h2, [class*='veh-name'], [class*='vehicle-name'], [class*='model']"
-            )
+            name_el = card_fields["name"]
             car_name = name_el.get_text(strip=True) if name_el else ""
             if car_name:
                 logging.info(f"✅ [SCRAPING-H2] Nome extraído do h2/título: '{car_name}'")
@@ -13241,7 +14458,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
                     "LOC": "Million",
                 }
                 code = ""
-                for im in card.select("img[src]"):
+                for im in card.find_all("img", src=True):
                     src = im.get("src") or ""
                     mcode = LOGO_CODE_RX.search(src)
                     if mcode:
@@ -13252,7 +14469,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
                     supplier = supplier_alias.get(code, code)
                 if not supplier:
                     # textual fallback but avoid using car name
-                    supplier_el = card.select_one(".supplier, .vendor, .partner, [class*='supplier'], [class*='vendor']")
+                    supplier_el = card_fields["supplier"]
                     txt = supplier_el.get_text(strip=True) if supplier_el else ""
                     if txt and txt.lower() != (car_name or "").lower():
                         supplier = txt
@@ -13266,7 +14483,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             photo = ""
             try:
                 # PRIORIDADE 1: img.cl--car-img (CarJet específico)
-                car_img = card.select_one("img.cl--car-img")
+                car_img = card_fields["car_img"]
                 if car_img:
                     src = (car_img.get("src") or car_img.get("data-src") or car_img.get("data-original") or "").strip()
                     if src:
@@ -13409,7 +14626,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             
             try:
                 # Procurar ícone de transmissão automática
-                trans_icon = card.select_one("i.icon-transm-auto, i.icon.icon-transm-auto")
+                trans_icon = card_fields["trans_auto"]
                 logging.info(f"   🔍 Busca 'icon-transm-auto': {'ENCONTRADO ✅' if trans_icon else 'NÃO encontrado'}")
                 
                 if trans_icon:
@@ -13421,7 +14638,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
                         logging.info(f"   ✅ Confirmado por texto: '{parent_text}'")
                 else:
                     # Verificar se tem ícone manual (icon-transm SEM auto)
-                    trans_icon_manual = card.select_one("i.icon-transm")
+                    trans_icon_manual = card_fields["trans"]
                     logging.info(f"   🔍 Busca 'icon-transm' (sem auto): {'ENCONTRADO ✅' if trans_icon_manual else 'NÃO encontrado'}")
                     
                     if trans_icon_manual:
@@ -13452,7 +14669,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
                 logging.error(f"❌ [ICON-TRANS] Erro ao detectar transmissão de '{car_name}': {e}", exc_info=True)
             
             # category
-            cat_el = card.select_one(".category, .group, .vehicle-category, [class*='category'], [class*='group'], [class*='categoria'], [class*='grupo']")
+            cat_el = card_fields["category"]
             category = cat_el.get_text(strip=True) if cat_el else ""
             # Canonicalize category to expected groups
             def _canon(cat: str) -> str:
@@ -13797,22 +15014,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             except Exception:
                 pass
             # Group D (Economy) models; Auto -> Economy Automatic (use card-level text for auto detection)
-            d_models = [
-                r"dacia\s+sandero",
-                r"peugeot\s*208",
-                r"opel\s*corsa",
-                r"seat\s*ibiza",
-                r"seat\s*leon",
-                r"kia\s*ceed",
-                r"(vw|volkswagen)\s*polo",
-                r"renault\s*clio",
-                r"ford\s*fiesta",
-                r"ford\s*focus",
-                r"hyundai\s*i20",
-                r"nissan\s*micra",
-                r"audi\s*a1",
-            ]
-            if any(re.search(p, cn) for p in d_models):
+            if D_MODELS_RX.search(cn):
                 _ct = ""
                 try:
                     _ct = card.get_text(" ", strip=True).lower()
@@ -13855,7 +15057,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             except Exception:
                 pass
             # link
-            link = url_from_row(card, base_url) or base_url
+            link = url_from_row(card, base_url, card_fields) or base_url
             
             # 🔍 BUSCAR TRANSMISSÃO NA PÁGINA DE DETALHES (se necessário)
             # Estratégia: Buscar transmissão SEMPRE que não conseguimos determinar pelo nome
@@ -13907,25 +15109,9 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             # FINAL OVERRIDE: Ensure Group D/E2 models are correctly placed (Peugeot 208, Opel Corsa, Seat Ibiza, VW Polo, Renault Clio, Ford Fiesta, Nissan Micra, Hyundai i20, Audi A1)
             try:
                 cn2 = (car_name or "").lower()
-                d_models_final = [
-                    r"\bpeugeot\s*208\b",
-                    r"\bopel\s*corsa\b",
-                    r"\bseat\s*ibiza\b",
-                    r"\bseat\s*leon\b",
-                    r"\bkia\s*ceed\b",
-                    r"\b(vw|volkswagen)\s*polo\b",
-                    r"\bcitro[eë]n\s*c3\b",
-                    r"\brenault\s*clio\b",
-                    r"\bford\s*fiesta\b",
-                    r"\bford\s*focus\b",
-                    r"\bnissan\s*micra\b",
-                    r"\bhyundai\s*i20\b",
-                    r"\baudi\s*a1\b",
-                    r"\bdacia\s*sandero\b",
-                ]
                 # do not override if we already mapped to protected groups (wagon/crossover/suv)
                 is_protected = category in ("Estate/Station Wagon", "Station Wagon Automatic", "Crossover", "SUV", "SUV Automatic")
-                if (not is_protected) and any(re.search(p, cn2) for p in d_models_final):
+                if (not is_protected) and D_MODELS_FINAL_RX.search(cn2):
                     if _is_auto_flag(cn2, _txt, transmission_label):
                         category = "Economy Automatic"
                     else:
@@ -13935,12 +15121,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             # FINAL MANUAL OVERRIDE for D models: if manual is explicit, force D
             try:
                 cn2b = (car_name or "").lower()
-                is_d_family = any(re.search(p, cn2b) for p in [
-                    r"\bpeugeot\s*208\b", r"\bopel\s*corsa\b", r"\bseat\s*ibiza\b",
-                    r"\bseat\s*leon\b", r"\b(vw|volkswagen)\s*golf\b", r"\b(vw|volkswagen)\s*polo\b",
-                    r"\brenault\s*clio\b", r"\bford\s*fiesta\b", r"\bnissan\s*micra\b",
-                    r"\bhyundai\s*i20\b", r"\baudi\s*a1\b", r"\bdacia\s*sandero\b", r"\brenault\s*megane\b",
-                ])
+                is_d_family = bool(D_FAMILY_RX.search(cn2b))
                 # re-evaluate card text for manual marker
                 _txt2 = ""
                 try:
@@ -14072,19 +15253,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             # FINAL N OVERRIDE: 9-seater vans -> N (wins over everything)
             try:
                 cn_n = (car_name or "").lower()
-                n_patterns = [
-                    r"\bmercedes\s*vito\b",  # ADDED: Mercedes Vito é N
-                    r"\bmercedes\s*v[-\s]?class\b",  # ADDED: Mercedes V-Class é N
-                    r"\bford\s*transit\b",  # ADDED: Ford Transit é N
-                    r"\bford\s*tourneo\b",  # Ford Tourneo é N
-                    r"\brenault\s*trafic\b",  # ADDED: Renault Trafic é N
-                    r"\bpeugeot\s*traveller\b",  # Peugeot Traveller é N
-                    r"\bcitro[eë]n\s*spacetourer\b",  # Citroen SpaceTourer é N (9 lugares)
-                    r"\btoyota\s*proace\b",  # ADDED: Toyota Proace é N
-                    r"\bopel\s*vivaro\b",  # ADDED: Opel Vivaro é N
-                    r"\bfiat\s*talento\b",  # ADDED: Fiat Talento é N
-                ]
-                if any(re.search(p, cn_n) for p in n_patterns):
+                if N_VAN_RX.search(cn_n):
                     category = "9 Seater"
                     logging.info(f"🚗 [N-OVERRIDE] Detected N 9-seater van: {car_name}")
             except Exception:
@@ -14092,22 +15261,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             # FINAL M2 OVERRIDE: common 7-seater autos -> 7 Seater Automatic (wins over J1/D)
             try:
                 cn4 = (car_name or "").lower()
-                m2_patterns = [
-                    r"\bcitro[eë]n\s*c4\s*(picasso|grand\s*spacetourer|grand\s*space\s*tourer)\b",
-                    r"\bcitro[eë]n\s*grand\s*picasso\b",
-                    r"\brenault\s*grand\s*sc[eé]nic\b",
-                    r"\bmercedes\s*glb\b.*\b(7\s*seater|7\s*lugares|7p|7\s*seats)\b",
-                    r"\b(vw|volkswagen)\s*multivan\b",
-                    r"\b(vw|volkswagen)\s*caddy\b",  # ADDED: VW Caddy é M2 quando auto
-                    r"\b(vw|volkswagen)\s*sharan\b",  # ADDED: VW Sharan é M2 quando auto
-                    r"\bseat\s*alhambra\b",  # ADDED: Seat Alhambra é M2 quando auto
-                    r"\bford\s*galaxy\b",  # ADDED: Ford Galaxy é M2 quando auto
-                    r"\bpeugeot\s*rifter\b",
-                    r"\bpeugeot\s*5008\b",  # ADDED: Peugeot 5008 é M2 quando auto
-                    r"\bdacia\s*jogger\b",  # ADDED: Dacia Jogger é M2 quando auto
-                    r"\bopel\s*zafira\b",  # ADDED: Opel Zafira é M2 quando auto
-                ]
-                if any(re.search(p, cn4) for p in m2_patterns) and _is_auto_flag(cn4, _txt, transmission_label):
+                if M2_MODELS_RX.search(cn4) and _is_auto_flag(cn4, _txt, transmission_label):
                     category = "7 Seater Automatic"
                     logging.info(f"🚗 [M2-OVERRIDE] Detected M2 car: {car_name}")
             except Exception:
@@ -14115,17 +15269,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             # FINAL E1 OVERRIDE: Mini Auto models -> Mini Automatic (avoid uncategorized)
             try:
                 cn5 = (car_name or "").lower()
-                e1_patterns = [
-                    r"\btoyota\s*aygo\b",
-                    r"\bkia\s*picanto\b",
-                    r"\bfiat\s*panda\b",  # ADDED: Fiat Panda Auto é E1
-                    r"\bhyundai\s*i10\b",  # ADDED: Hyundai i10 Auto é E1
-                    r"\bfiat\s*500\b",  # Fiat 500 Auto é E1 (4 lugares)
-                    r"\bpeugeot\s*108\b",
-                    r"\bcitro[eë]n\s*c1\b",
-                    r"\b(vw|volkswagen)\s*up\b",
-                ]
-                if any(re.search(p, cn5) for p in e1_patterns) and _is_auto_flag(cn5, _txt, transmission_label):
+                if E1_MODELS_RX.search(cn5) and _is_auto_flag(cn5, _txt, transmission_label):
                     category = "Mini Automatic"
                     logging.info(f"🚗 [E1-OVERRIDE] Detected E1 Mini Auto: {car_name}")
             except Exception:
@@ -14139,29 +15283,12 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
                 pass
             # FINAL B1 OVERRIDE: base mini models -> 'Mini 4 Doors' (when not auto/cabrio/special variants)
             try:
-                b1_list = [
-                    r"\bfiat\s*500\b",
-                    r"\bcitro[eë]n\s*c1\b",
-                    r"\bpeugeot\s*108\b",
-                    r"\bopel\s*adam\b",
-                    r"\btoyota\s*aygo\b",
-                    r"\b(vw|volkswagen)\s*up\b",
-                    r"\bford\s*ka\b",
-                    r"\brenault\s*twingo\b",
-                    r"\bkia\s*picanto\b",
-                ]
                 _name = (car_name or "").lower()
-                if any(re.search(p, _name) for p in b1_list):
+                if B1_MODELS_RX.search(_name):
                     # do not apply if this is a D/E2 economy model (protect Group D)
-                    d_guard = [
-                        r"\bpeugeot\s*208\b", r"\bopel\s*corsa\b", r"\bseat\s*ibiza\b",
-                        r"\b(vw|volkswagen)\s*polo\b", r"\bcitro[eë]n\s*c3\b", r"\brenault\s*clio\b",
-                        r"\bford\s*fiesta\b", r"\bnissan\s*micra\b", r"\bhyundai\s*i20\b", r"\baudi\s*a1\b",
-                        r"\bdacia\s*sandero\b"
-                    ]
                     # ADDED: Hyundai i10 é B2, não B1 (5 lugares)
                     b2_guard = [r"\bhyundai\s*i10\b"]
-                    if any(re.search(p, _name) for p in d_guard):
+                    if B1_D_GUARD_RX.search(_name):
                         raise Exception("skip B1 for D/E2 models")
                     if any(re.search(p, _name) for p in b2_guard):
                         raise Exception("skip B1 for i10 - it's B2")
@@ -14187,14 +15314,19 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             # 🔍 VERIFICAR VEHICLES (carjet_direct.py) - Comparar com transmissão detectada
             vehicles_match = None
             vehicles_transmission = None
+            vehicles_group = None
             try:
                 from carjet_direct import VEHICLES
                 car_name_lower = car_name.lower()
                 for veh_name, veh_data in VEHICLES.items():
                     if veh_name.lower() in car_name_lower or car_name_lower in veh_name.lower():
                         vehicles_match = veh_name
-                        vehicles_transmission = veh_data.get('transmission', 'Unknown')
-                        vehicles_group = veh_data.get('group', 'Unknown')
+                        # VEHICLES guarda só a categoria (str); entradas dict trazem também a transmissão
+                        if isinstance(veh_data, dict):
+                            vehicles_transmission = veh_data.get('transmission', 'Unknown')
+                            vehicles_group = veh_data.get('group', 'Unknown')
+                        else:
+                            vehicles_group = veh_data
                         
                         # ALERTA: Se VEHICLES diz Manual mas detectamos Automatic (ou vice-versa)
                         if vehicles_transmission and final_transmission:
@@ -14222,7 +15354,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
             
             logging.info(f"✅ [FINAL-RESULT] {car_name} → GRUPO '{group_code}' | {final_transmission} | {supplier} | {price_text}")
             if vehicles_match:
-                logging.info(f"      VEHICLES: '{vehicles_match}' → grupo {veh_data.get('group')} | {vehicles_transmission}")
+                logging.info(f"      VEHICLES: '{vehicles_match}' → grupo {vehicles_group} | {vehicles_transmission}")
             # Capitalizar nome para display (Peugeot 2008 Auto, Renault Megane SW Auto)
             car_name_display = capitalize_car_name(car_name)
             items.append({
@@ -14238,6 +15370,7 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
                 "link": link,
             })
             idx += 1
+        _flush_photo_cache()
         print(f"[PARSE] Stats: price={cards_with_price}, name={cards_with_name}, blocked={cards_blocked}, items={len(items)}")
         
         # 📊 ESTATÍSTICAS DETALHADAS DE TRANSMISSÃO E GRUPOS
@@ -14296,9 +15429,6 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
     except Exception:
         pass
 
-    # Require an explicit currency marker to avoid capturing ratings/ages
-    price_regex = re.compile(r"(?:€\s*\d{1,4}(?:[\.,]\d{3})*(?:[\.,]\d{2})?|\bEUR\s*\d{1,4}(?:[\.,]\d{3})*(?:[\.,]\d{2})?)", re.I)
-
     # Basic category keyword list (EN + PT)
     CATEGORY_KEYWORDS = [
         "mini","economy","compact","intermediate","standard","full-size","full size","suv","premium","luxury","van","estate","convertible","people carrier","minivan","midsize",
@@ -14306,7 +15436,8 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
     ]
 
     candidates = []
-    for el in soup.find_all(text=price_regex):
+    # Require an explicit currency marker to avoid capturing ratings/ages (PRICE_TEXT_RX)
+    for el in _find_price_strings(soup):
         try:
             txt = el.strip()
         except Exception:
@@ -14409,17 +15540,19 @@ def parse_prices(html: str, base_url: str) -> List[Dict[str, Any]]:
     return items
 
 
-def url_from_row(row, base_url: str) -> str:
-    a = row.select_one("a[href]")
+def url_from_row(row, base_url: str, fields: Optional[Dict[str, Any]] = None) -> str:
+    if fields is None:
+        fields = _scan_card(row, ("href", "data-href", "data-url", "data-link", "onclick"))
+    a = fields["href"]
     if a and a.has_attr("href"):
         href = a["href"]
         if href and not href.lower().startswith("javascript") and href != "#":
             return urljoin(base_url, href)
     for attr in ["data-href", "data-url", "data-link"]:
-        el = row.select_one(f"*[{attr}]")
+        el = fields[attr]
         if el and el.has_attr(attr):
             return urljoin(base_url, el[attr])
-    clickable = row.select_one("*[onclick]")
+    clickable = fields["onclick"]
     if clickable and clickable.has_attr("onclick"):
         m = re.search(r"https?://[^'\"]+", clickable["onclick"])  
         if m:
@@ -14837,38 +15970,67 @@ def post_with_optional_proxy(url: str, data: Dict[str, Any], headers: Dict[str,
     return requests.post(url, headers=headers, data=data, timeout=20)
 
 
+class _TokenBucket:
+    """Token bucket async partilhado: `rate` pedidos/s com rajadas até `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Limite global de pedidos ao CarJet (todas as pesquisas bulk, todas as localizações)
+_BULK_RATE_LIMITER = _TokenBucket(GLOBAL_FETCH_RPS, GLOBAL_FETCH_BURST)
+
+
+def _bulk_stream_format(request: Request, body: Dict[str, Any]) -> Optional[str]:
+    """'ndjson' | 'sse' | None (resposta JSON única, como antes)"""
+    fmt = str(body.get("stream") or request.query_params.get("stream") or "").strip().lower()
+    if fmt in ("ndjson", "sse"):
+        return fmt
+    if fmt in ("1", "true", "yes", "on"):
+        return "ndjson"
+    accept = request.headers.get("accept", "")
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return None
+
+
 @app.post("/api/bulk-prices")
 async def bulk_prices(request: Request):
+    """Preços para várias localizações x durações
+
+    Todas as (localização, duração) correm em paralelo (máx. BULK_CONCURRENCY por
+    pedido, GLOBAL_FETCH_RPS no total). Com stream=ndjson|sse (body, query ou Accept)
+    cada resultado é enviado assim que fica pronto; sem stream a resposta é a mesma
+    de sempre ({"ok", "results": [{location, durations}]}).
+    """
     require_auth(request)
     body = await request.json()
     locations: List[Dict[str, Any]] = body.get("locations", [])
     supplier_priority: Optional[str] = body.get("supplier_priority")
     durations = body.get("durations", [1,2,3,4,5,6,7,8,9,14,22,31,60])
+    stream_format = _bulk_stream_format(request, body)
 
-    results: List[Dict[str, Any]] = []
     headers = {"User-Agent": "Mozilla/5.0 (compatible; PriceTracker/1.0)"}
 
-    # Global simple rate limiter (shared across requests)
-    _RL_LOCK = getattr(bulk_prices, "_RL_LOCK", None)
-    if _RL_LOCK is None:
-        _RL_LOCK = asyncio.Lock()
-        setattr(bulk_prices, "_RL_LOCK", _RL_LOCK)
-    _RL_LAST = getattr(bulk_prices, "_RL_LAST", 0.0)
-    _RL_MIN_INTERVAL = 1.0 / GLOBAL_FETCH_RPS if GLOBAL_FETCH_RPS and GLOBAL_FETCH_RPS > 0 else 0.0
-
-    async def _rate_limit_tick():
-        nonlocal _RL_LAST
-        if _RL_MIN_INTERVAL <= 0:
-            return
-        async with _RL_LOCK:
-            now = time.time()
-            wait = _RL_MIN_INTERVAL - (now - _RL_LAST)
-            if wait > 0:
-                await asyncio.sleep(wait)
-                now = time.time()
-            _RL_LAST = now
-            setattr(bulk_prices, "_RL_LAST", _RL_LAST)
-
     async def _fetch_parse(url: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         # Retry up to 2 attempts for transient failures
         attempts = 0
@@ -14877,7 +16039,7 @@ async def bulk_prices(request: Request):
             attempts += 1
             t0 = time.time()
             try:
-                await _rate_limit_tick()
+                await _BULK_RATE_LIMITER.acquire()
                 r = await async_fetch_with_optional_proxy(url, headers=headers)
                 r.raise_for_status()
                 html = r.text
@@ -14902,30 +16064,59 @@ async def bulk_prices(request: Request):
                 await asyncio.sleep(0.3 * attempts)
         raise last_exc  # type: ignore
 
-    for loc in locations:
+    # Cap concurrency to avoid overloading Render (CPU/net) - partilhado por todas as localizações
+    sem = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def _worker(loc_index: int, name: str, url: str, days: int):
+        async with sem:
+            try:
+                items, timing = await _fetch_parse(url)
+                result = {"days": days, "count": len(items), "items": items, "timing": timing}
+            except Exception as e:
+                result = {"days": days, "error": str(e), "items": [], "timing": {"attempts": BULK_MAX_RETRIES}}
+        return loc_index, name, result
+
+    results: List[Dict[str, Any]] = []
+    tasks = []
+    for loc_index, loc in enumerate(locations):
         name = loc.get("name", "")
         urls: List[str] = loc.get("urls", [])
-        loc_block = {"location": name, "durations": []}
-        # Cap concurrency to avoid overloading Render (CPU/net)
-        sem = asyncio.Semaphore(BULK_CONCURRENCY)
-        async def _worker(index: int, url: str, days: int):
-            async with sem:
-                try:
-                    items, timing = await _fetch_parse(url)
-                    return {"days": days, "count": len(items), "items": items, "timing": timing}
-                except Exception as e:
-                    return {"days": days, "error": str(e), "items": [], "timing": {"attempts": BULK_MAX_RETRIES}}
-
-        tasks = []
+        results.append({"location": name, "durations": []})
         for idx, url in enumerate(urls):
             days = durations[idx] if idx < len(durations) else None
             if not url or days is None:
                 continue
-            tasks.append(_worker(idx, url, days))
-        if tasks:
-            loc_block["durations"] = await asyncio.gather(*tasks)
-        results.append(loc_block)
-    return JSONResponse({"ok": True, "results": results})
+            tasks.append(_worker(loc_index, name, url, days))
+
+    if stream_format is None:
+        for loc_index, _name, result in await asyncio.gather(*tasks):
+            results[loc_index]["durations"].append(result)
+        return JSONResponse({"ok": True, "results": results})
+
+    def _frame(event: str, payload: Dict[str, Any]) -> str:
+        if stream_format == "sse":
+            return _sse_frame(event, payload)
+        return json.dumps(payload, ensure_ascii=False, default=str) + "\n"
+
+    async def _stream():
+        pending = [asyncio.ensure_future(t) for t in tasks]
+        try:
+            done_count = 0
+            for next_done in asyncio.as_completed(pending):
+                _loc_index, name, result = await next_done
+                done_count += 1
+                yield _frame("result", {"location": name, **result})
+            yield _frame("done", {"ok": True, "done": True, "total": done_count})
+        finally:
+            # Cliente desligou-se a meio: não continuar a pedir ao CarJet
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(_stream(), media_type=media_type,
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no",
+                                      "Content-Encoding": "identity"})
 
 
 @app.post("/api/track-by-url")
@@ -15362,7 +16553,7 @@ async def track_by_url(request: Request):
         # persist snapshot so UI can show the rows immediately
         try:
             if start_dt and days:
-                save_snapshots(location, start_dt, int(days), items, currency or "")
+                await _run_db(save_snapshots, location, start_dt, int(days), items, currency or "")
         except Exception:
             pass
         from datetime import datetime as _dt
@@ -15926,7 +17117,7 @@ async def track_carjet(request: Request):
                             items = normalize_and_sort(items, supplier_priority)
                             # FILTRAR APENAS AUTOMÁTICOS
                             items = filter_automatic_only(items)
-                            save_snapshots(name, start_dt, d, items, currency)
+                            await _run_db(save_snapshots, name, start_dt, d, items, currency)
                             
                             # Save to search history
                             try:
@@ -16344,45 +17535,77 @@ async def debug_html(request: Request):
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
 
-def save_snapshots(location: str, start_dt, days: int, items: List[Dict[str, Any]], currency: str):
+def _save_snapshots_executemany(location: str, start_dt, days: int, items: List[Dict[str, Any]], currency: str) -> Dict[str, Any]:
+    """save_snapshots sem o módulo database: um executemany simples (sem rollup diário)"""
     from datetime import datetime
     ts = datetime.utcnow().isoformat(timespec="seconds")
+    rows = [
+        (
+            ts,
+            location,
+            start_dt.strftime("%Y-%m-%d"),
+            start_dt.strftime("%H:%M"),
+            int(days),
+            (it.get("supplier") or "").strip(),
+            (it.get("car") or "").strip(),
+            (it.get("price") or "").strip(),
+            it.get("price_num"),
+            currency or (it.get("currency") or ""),
+            (it.get("link") or "").strip(),
+        )
+        for it in items
+    ]
+    started = time.perf_counter()
     with _db_lock:
         conn = _db_connect()
         try:
-            for it in items:
-                conn.execute(
-                    """
-                    INSERT INTO price_snapshots (ts, location, pickup_date, pickup_time, days, supplier, car, price_text, price_num, currency, link)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        ts,
-                        location,
-                        start_dt.strftime("%Y-%m-%d"),
-                        start_dt.strftime("%H:%M"),
-                        int(days),
-                        (it.get("supplier") or "").strip(),
-                        (it.get("car") or "").strip(),
-                        (it.get("price") or "").strip(),
-                        it.get("price_num"),
-                        currency or (it.get("currency") or ""),
-                        (it.get("link") or "").strip(),
-                    ),
-                )
-        finally:
+            conn.executemany(
+                """
+                INSERT INTO price_snapshots (ts, location, pickup_date, pickup_time, days, supplier, car, price_text, price_num, currency, link)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
             conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
             conn.close()
+    elapsed = time.perf_counter() - started
+    rate = round(len(rows) / elapsed, 1) if elapsed > 0 else float(len(rows))
+    return {"rows": len(rows), "seconds": round(elapsed, 4), "rows_per_second": rate}
 
+def save_snapshots(location: str, start_dt, days: int, items: List[Dict[str, Any]], currency: str) -> Dict[str, Any]:
+    """Grava os items em price_snapshots numa só transação (insert em lote)
 
-@app.get("/api/history")
-async def get_history(request: Request):
-    require_auth(request)
-    params = request.query_params
-    location = params.get("location")
-    supplier = params.get("supplier")
-    days = params.get("days")
-    since = params.get("from")
+    Devolve {"rows", "seconds", "rows_per_second"}.
+    """
+    if _bulk_insert_price_snapshots is None:
+        return _save_snapshots_executemany(location, start_dt, days, items, currency)
+    rows = _price_snapshot_rows(location, start_dt, days, items, currency)
+    with _db_lock:
+        conn = _db_connect()
+        try:
+            groups = [it.get("group") or "" for it in items]
+            stats = _bulk_insert_price_snapshots(conn, rows, groups=groups)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    return stats
+
+
+@app.get("/api/history")
+async def get_history(request: Request):
+    require_auth(request)
+    params = request.query_params
+    location = params.get("location")
+    supplier = params.get("supplier")
+    days = params.get("days")
+    since = params.get("from")
     until = params.get("to")
     limit = int(params.get("limit", 200))
 
@@ -16473,48 +17696,35 @@ async def upload_price_automation(request: Request, file: UploadFile = File(...)
             "traceback": traceback.format_exc()
         }, status_code=400)
 
-@app.get("/api/price-history")
-async def get_price_history(request: Request):
-    """API para dados de gráficos de histórico de preços"""
-    require_auth(request)
-    params = request.query_params
-    location = params.get("location", "")
-    days = params.get("days", "")
-    category = params.get("category", "")
-    
+def _query_price_history(location: str, days: str) -> Dict[str, Any]:
+    """Agregações para os gráficos de histórico (corre no executor da BD)
+
+    Lê do rollup diário price_snapshot_daily (mantido pelo save_snapshots);
+    AVG = SUM(sum_price) / SUM(n), igual ao AVG(price_num) sobre price_snapshots.
+    """
     with _db_lock:
         conn = _db_connect()
         try:
-            # Detect database type
-            import psycopg2
-            is_postgres = isinstance(conn, psycopg2.extensions.connection)
-            
-            # Evolução de preços ao longo do tempo (últimos 30 dias) - MIN, AVG, MAX
-            evolution_query = """
-                SELECT DATE(ts) as date, 
-                       MIN(price_num) as min_price,
-                       AVG(price_num) as avg_price,
-                       MAX(price_num) as max_price
-                FROM price_snapshots
-                WHERE price_num IS NOT NULL AND price_num > 0
-            """
-            evolution_query = _adapt_query_for_db(evolution_query, is_postgres)
-            evolution_args = []
-            placeholder = "%s" if is_postgres else "?"
+            filters = ""
+            args: List[Any] = []
             if location:
-                evolution_query += f" AND location = {placeholder}"
-                evolution_args.append(location)
+                filters += " AND location = ?"
+                args.append(location)
             if days:
-                evolution_query += f" AND days = {placeholder}"
-                evolution_args.append(int(days))
-            # Nota: categoria não está na tabela, filtrar por car name como aproximação
-            # if category:
-            #     evolution_query += f" AND car LIKE {placeholder}"
-            #     evolution_args.append(f"%{category}%")
-            group_by_clause = " GROUP BY DATE(ts::timestamp) ORDER BY DATE(ts::timestamp) DESC LIMIT 30" if is_postgres else " GROUP BY DATE(ts) ORDER BY DATE(ts) DESC LIMIT 30"
-            evolution_query += group_by_clause
+                filters += " AND days = ?"
+                args.append(int(days))
+            # Nota: car_group existe no rollup mas só para snapshots novos (histórico fica com '')
             
-            evolution_rows = conn.execute(evolution_query, tuple(evolution_args)).fetchall()
+            # Evolução de preços ao longo do tempo (últimos 30 dias) - MIN, AVG, MAX
+            evolution_rows = conn.execute(f"""
+                SELECT day,
+                       MIN(min_price) as min_price,
+                       SUM(sum_price) / SUM(n) as avg_price,
+                       MAX(max_price) as max_price
+                FROM price_snapshot_daily
+                WHERE 1=1{filters}
+                GROUP BY day ORDER BY day DESC LIMIT 30
+            """, tuple(args)).fetchall()
             evolution_labels = [r[0] for r in reversed(evolution_rows)]
             evolution_min = [round(r[1], 2) if r[1] else 0 for r in reversed(evolution_rows)]
             evolution_avg = [round(r[2], 2) if r[2] else 0 for r in reversed(evolution_rows)]
@@ -16522,14 +17732,13 @@ async def get_price_history(request: Request):
             
             # Comparação por localização (sempre Faro vs Albufeira)
             comparison_query = """
-                SELECT location, AVG(price_num) as avg_price
-                FROM price_snapshots
-                WHERE price_num IS NOT NULL AND price_num > 0
-                  AND location IN ('Aeroporto de Faro', 'Albufeira')
+                SELECT location, SUM(sum_price) / SUM(n) as avg_price
+                FROM price_snapshot_daily
+                WHERE location IN ('Aeroporto de Faro', 'Albufeira')
             """
             comparison_args = []
             if days:
-                comparison_query += f" AND days = {placeholder}"
+                comparison_query += " AND days = ?"
                 comparison_args.append(int(days))
             comparison_query += " GROUP BY location ORDER BY location"
             
@@ -16544,28 +17753,12 @@ async def get_price_history(request: Request):
             ]
             
             # Preços médios por mês do ano
-            if is_postgres:
-                monthly_query = """
-                    SELECT EXTRACT(MONTH FROM ts::timestamp)::INTEGER as month, AVG(price_num) as avg_price
-                    FROM price_snapshots
-                    WHERE price_num IS NOT NULL AND price_num > 0
-                """
-            else:
-                monthly_query = """
-                    SELECT CAST(strftime('%m', ts) AS INTEGER) as month, AVG(price_num) as avg_price
-                    FROM price_snapshots
-                    WHERE price_num IS NOT NULL AND price_num > 0
-                """
-            monthly_args = []
-            if location:
-                monthly_query += f" AND location = {placeholder}"
-                monthly_args.append(location)
-            if days:
-                monthly_query += f" AND days = {placeholder}"
-                monthly_args.append(int(days))
-            monthly_query += " GROUP BY month ORDER BY month"
-            
-            monthly_rows = conn.execute(monthly_query, tuple(monthly_args)).fetchall()
+            monthly_rows = conn.execute(f"""
+                SELECT CAST(SUBSTR(day, 6, 2) AS INTEGER) as month, SUM(sum_price) / SUM(n) as avg_price
+                FROM price_snapshot_daily
+                WHERE 1=1{filters}
+                GROUP BY month ORDER BY month
+            """, tuple(args)).fetchall()
             monthly_values = [0] * 12
             for r in monthly_rows:
                 month_idx = r[0] - 1  # 1-12 -> 0-11
@@ -16575,7 +17768,7 @@ async def get_price_history(request: Request):
         finally:
             conn.close()
     
-    return JSONResponse({
+    return {
         "ok": True,
         "evolution": {
             "labels": evolution_labels,
@@ -16590,7 +17783,18 @@ async def get_price_history(request: Request):
         "monthly": {
             "values": monthly_values
         }
-    })
+    }
+
+@app.get("/api/price-history")
+async def get_price_history(request: Request):
+    """API para dados de gráficos de histórico de preços"""
+    require_auth(request)
+    params = request.query_params
+    location = params.get("location", "")
+    days = params.get("days", "")
+    category = params.get("category", "")
+    
+    return JSONResponse(await _run_db(_query_price_history, location, days))
 
 # ============================================================
 # VEHICLES MANAGEMENT ENDPOINTS
@@ -16721,6 +17925,7 @@ async def save_vehicle(request: Request):
                 con.commit()
             finally:
                 con.close()
+        invalidate_vehicle_classifier()
         
         # Atualizar carjet_direct.py automaticamente
         try:
@@ -16772,6 +17977,7 @@ async def save_vehicle(request: Request):
             
             # Recarregar o módulo
             importlib.reload(carjet_direct)
+            invalidate_vehicle_classifier()
             
             message = "Vehicle saved and carjet_direct.py updated automatically!"
         except Exception as e:
@@ -16866,10 +18072,8 @@ async def admin_price_automation_settings(request: Request):
     """Página de parametrizações para automação de preços"""
     require_auth(request)
     
-    html_path = os.path.join(os.path.dirname(__file__), "templates", "price_automation_settings.html")
     try:
-        with open(html_path, 'r', encoding='utf-8') as f:
-            return HTMLResponse(content=f.read())
+        return HTMLResponse(content=_page_html("price_automation_settings.html"))
     except FileNotFoundError:
         return HTMLResponse(content="<h1>Erro: price_automation_settings.html não encontrado</h1>", status_code=500)
 
@@ -16944,6 +18148,7 @@ async def upload_damage_report_template(request: Request):
                 
                 placeholder = "%s" if is_postgres else "?"
                 
+                _lock_table_for_update(conn, "damage_report_templates")
                 cursor = conn.execute("SELECT MAX(version) FROM damage_report_templates")
                 row = cursor.fetchone()
                 next_version = (row[0] or 0) + 1
@@ -16974,6 +18179,7 @@ async def upload_damage_report_template(request: Request):
                 # Guardar também como ficheiro
                 with open('Damage Report.pdf', 'wb') as f:
                     f.write(pdf_content)
+                _damage_pdf_template_changed()
                 
                 logging.info(f"✅ Template v{next_version} carregado por {username}")
                 
@@ -18919,8 +20125,10 @@ async def startup_automated_scheduler():
     try:
         logging.info("🤖 Starting automated reports scheduler...")
         print("📦 Importing automated_scheduler module...", flush=True)
-        from automated_scheduler import setup_scheduled_tasks
+        from automated_scheduler import setup_scheduled_tasks, start_search_queue
         print("✅ Module imported successfully", flush=True)
+        # Pesquisas agendadas chamam o pipeline diretamente (sem loopback HTTP)
+        await start_search_queue(_scheduler_track_search)
         print("🔧 Calling setup_scheduled_tasks()...", flush=True)
         setup_scheduled_tasks()
         print("✅ SCHEDULER INITIALIZED SUCCESSFULLY!", flush=True)
@@ -18938,8 +20146,9 @@ async def shutdown_automated_scheduler():
     """🛑 Desligar scheduler ao parar aplicação"""
     try:
         logging.info("🛑 Shutting down automated scheduler...")
-        from automated_scheduler import shutdown_scheduler
+        from automated_scheduler import shutdown_scheduler, stop_search_queue
         shutdown_scheduler()
+        await stop_search_queue()
         logging.info("✅ Automated scheduler stopped")
     except Exception as e:
         logging.error(f"❌ Error stopping scheduler: {str(e)}")
@@ -18964,6 +20173,18 @@ async def reload_scheduler(request: Request):
             "error": str(e)
         }, status_code=500)
 
+@app.get("/api/scheduler/search-queue")
+async def get_scheduler_search_queue(request: Request):
+    """🧵 Progresso das pesquisas agendadas na fila em processo (runs e jobs)"""
+    require_auth(request)
+    
+    try:
+        from automated_scheduler import get_search_queue_status
+        return _no_store_json({"ok": True, **get_search_queue_status()})
+    except Exception as e:
+        logging.error(f"❌ Error reading search queue: {str(e)}")
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+
 @app.get("/api/scheduler/status")
 async def get_scheduler_status(request: Request):
     """📊 Obter status do scheduler e próximas execuções"""
@@ -19103,6 +20324,7 @@ async def upload_vehicle_photo(vehicle_name: str, request: Request, file: Upload
             finally:
                 conn.close()
         
+        _vehicle_photos_changed()
         return _no_store_json({
             "ok": True,
             "message": "Foto enviada com sucesso",
@@ -19171,6 +20393,7 @@ async def download_vehicle_photo_from_url(vehicle_name: str, request: Request):
             finally:
                 conn.close()
         
+        _vehicle_photos_changed()
         return _no_store_json({
             "ok": True,
             "message": "Foto baixada e salva com sucesso",
@@ -19603,6 +20826,7 @@ async def import_configuration(request: Request, file: UploadFile = File(...)):
                 finally:
                     conn.close()
             print(f"[IMPORT] Name Overrides: {imported_overrides} importados")
+            invalidate_vehicle_classifier()
         
         # 4. Importar car_groups
         imported_groups = 0
@@ -19642,6 +20866,7 @@ async def import_configuration(request: Request, file: UploadFile = File(...)):
                 finally:
                     conn.close()
             print(f"[IMPORT] Car Groups: {imported_groups} importados")
+            invalidate_vehicle_classifier()
         
         # 5. Importar vehicle_photos
         imported_photos = 0
@@ -19741,6 +20966,7 @@ async def import_configuration(request: Request, file: UploadFile = File(...)):
         
         print(f"[IMPORT] Importação completa!")
         
+        _vehicle_photos_changed()
         return _no_store_json({
             "ok": True,
             "message": "Configuração importada com sucesso!",
@@ -19792,256 +21018,474 @@ async def get_vehicles_last_update():
         "last_update": _vehicles_last_update
     })
 
+# --- Jobs em background (background_jobs.JobManager) ---
+# Operações longas de admin (scraping do CarJet, downloads de fotos, backups) correm
+# fora do pedido: o endpoint responde 202 com o job_id e o cliente acompanha em
+# /api/jobs/{id} (polling) ou /api/jobs/{id}/events (SSE). ?wait=1 mantém a resposta
+# antiga (espera pelo fim) para scripts. Um job de cada grupo de cada vez; o estado
+# vai para background_jobs para qualquer worker responder; o cancelamento de um job
+# de outro worker chega-lhe por NOTIFY.
+JOBS_MAX_RUNNING = max(1, int(os.getenv("JOBS_MAX_RUNNING", "3") or 3))
+JOBS_KEEP = 200  # jobs terminados guardados em memória
+JOBS_HEARTBEAT = 30.0
+JOBS_CANCEL_CHANNEL = "background_job_cancel"
+JOBS_REMOTE_POLL = 2.0  # SSE de um job de outro worker: leitura da BD
+JOBS_DDL = """
+    CREATE TABLE IF NOT EXISTS background_jobs (
+      id TEXT PRIMARY KEY,
+      kind TEXT NOT NULL,
+      status TEXT NOT NULL,
+      worker TEXT,
+      snapshot TEXT NOT NULL,
+      cancel_requested INTEGER DEFAULT 0,
+      created_at TEXT NOT NULL,
+      updated_at TEXT NOT NULL
+    );
+"""
+_jobs_table_ready = False
+
+def _ensure_background_jobs_table():
+    global _jobs_table_ready
+    if _jobs_table_ready:
+        return
+    with _db_lock:
+        con = _db_connect()
+        try:
+            con.execute(JOBS_DDL)
+            con.commit()
+            _jobs_table_ready = True
+        finally:
+            con.close()
+
+def _persist_job(snapshot: Dict[str, Any]):
+    _ensure_background_jobs_table()
+    now = datetime.now(timezone.utc).isoformat()
+    with _db_lock:
+        con = _db_connect()
+        try:
+            con.execute(
+                """
+                INSERT INTO background_jobs (id, kind, status, worker, snapshot, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET status=excluded.status, snapshot=excluded.snapshot,
+                    updated_at=excluded.updated_at
+                """,
+                (snapshot["id"], snapshot["kind"], snapshot["status"], _WORKER_ID,
+                 json.dumps(snapshot, default=str), snapshot["created_at"], now)
+            )
+            con.commit()
+        finally:
+            con.close()
+
+def _job_from_row(row) -> Dict[str, Any]:
+    """(snapshot, worker, cancel_requested, updated_at) -> snapshot; sem heartbeat há muito -> 'lost'"""
+    snapshot = json.loads(row[0])
+    snapshot["worker"] = row[1]
+    snapshot["cancel_requested"] = bool(snapshot.get("cancel_requested") or row[2])
+    if snapshot["status"] in ("queued", "running"):
+        try:
+            age = (datetime.now(timezone.utc) - datetime.fromisoformat(str(row[3]))).total_seconds()
+            if age > JOBS_HEARTBEAT * 3:
+                snapshot["status"] = "lost"
+                snapshot["error"] = snapshot.get("error") or "Worker stopped while the job was running"
+        except ValueError:
+            pass
+    return snapshot
+
+def _load_job_rows(job_id: Optional[str] = None, kind: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    _ensure_background_jobs_table()
+    sql = "SELECT snapshot, worker, cancel_requested, updated_at FROM background_jobs"
+    params: list = []
+    if job_id:
+        sql += " WHERE id = ?"
+        params.append(job_id)
+    elif kind:
+        sql += " WHERE kind = ?"
+        params.append(kind)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    with _db_lock:
+        con = _db_connect()
+        try:
+            rows = con.execute(sql, tuple(params)).fetchall()
+        finally:
+            con.close()
+    return [_job_from_row(r) for r in rows]
+
+def _request_remote_job_cancel(job_id: str) -> bool:
+    """Job de outro worker: marca na BD e avisa-o por NOTIFY"""
+    _ensure_background_jobs_table()
+    with _db_lock:
+        con = _db_connect()
+        try:
+            cur = con.execute(
+                "UPDATE background_jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')",
+                (job_id,)
+            )
+            updated = bool(getattr(cur, "rowcount", 0))
+            if updated and _USE_NEW_DB and USE_POSTGRES:
+                con.execute("SELECT pg_notify(?, ?)", (JOBS_CANCEL_CHANNEL, job_id))
+            con.commit()
+        finally:
+            con.close()
+    return updated
+
+_JOBS = background_jobs.JobManager(
+    max_running=JOBS_MAX_RUNNING,
+    # carjet_scrape: refresh + download-all-photos (um scraping completo de cada vez)
+    limits={"carjet_scrape": 1, "vehicle_photos": 1, "backup": 1},
+    keep=JOBS_KEEP,
+    persist=_persist_job,
+    heartbeat=JOBS_HEARTBEAT,
+)
+
+def _on_job_cancel_note(payload: str):
+    _JOBS.cancel_threadsafe(payload)
+
+_PG_LISTEN_HANDLERS[JOBS_CANCEL_CHANNEL] = _on_job_cancel_note
+
+def _wants_wait(request: Request) -> bool:
+    return str(request.query_params.get("wait", "")).strip().lower() in ("1", "true", "yes", "on")
+
+async def _submit_job(request: Request, kind: str, fn, params: Optional[Dict[str, Any]] = None,
+                      group: Optional[str] = None):
+    """Cria o job (ou devolve o mesmo pedido ainda em curso) e responde como _job_response"""
+    job = _JOBS.submit(kind, fn, params=params, group=group, created_by=request.session.get("username"))
+    return await _job_response(request, job)
+
+async def _job_response(request: Request, job: "background_jobs.Job"):
+    """202 com o job (ou, com ?wait=1, o resultado quando terminar, como a resposta antiga)"""
+    if _wants_wait(request):
+        await _JOBS.wait(job)
+        if job.status == background_jobs.DONE:
+            return _no_store_json(job.result)
+        return _no_store_json({"ok": False, "error": job.error or job.message or job.status, "job_id": job.id}, 500)
+    return _no_store_json({
+        "ok": True,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+        "cancel_url": f"/api/jobs/{job.id}/cancel",
+    }, 202)
+
+@app.get("/api/jobs")
+async def list_background_jobs(request: Request):
+    """Jobs recentes (deste worker em memória + os da BD); ?kind=...&limit=..."""
+    require_auth(request)
+    kind = request.query_params.get("kind") or None
+    try:
+        limit = max(1, min(int(request.query_params.get("limit") or 50), 200))
+    except ValueError:
+        return JSONResponse({"ok": False, "error": "limit inválido"}, status_code=400)
+    jobs = {job.id: job.snapshot() for job in _JOBS.list(kind)[:limit]}
+    try:
+        for snapshot in await _run_db(_load_job_rows, None, kind, limit):
+            jobs.setdefault(snapshot["id"], snapshot)
+    except Exception as e:
+        logging.warning(f"[JOBS] list: {e}")
+    ordered = sorted(jobs.values(), key=lambda j: j["created_at"], reverse=True)[:limit]
+    return _no_store_json({"ok": True, "jobs": ordered, "stats": _JOBS.snapshot()})
+
+async def _find_job_snapshot(job_id: str) -> Optional[Dict[str, Any]]:
+    job = _JOBS.get(job_id)
+    if job is not None:
+        return job.snapshot()
+    rows = await _run_db(_load_job_rows, job_id)
+    return rows[0] if rows else None
+
+@app.get("/api/jobs/{job_id}")
+async def get_background_job(request: Request, job_id: str):
+    require_auth(request)
+    snapshot = await _find_job_snapshot(job_id)
+    if snapshot is None:
+        return JSONResponse({"ok": False, "error": "Job not found"}, status_code=404)
+    return _no_store_json({"ok": True, "job": snapshot})
+
+@app.get("/api/jobs/{job_id}/events")
+async def background_job_events(request: Request, job_id: str):
+    """Server-Sent Events com o snapshot do job a cada alteração; termina com 'done'"""
+    require_auth(request)
+    snapshot = await _find_job_snapshot(job_id)
+    if snapshot is None:
+        return JSONResponse({"ok": False, "error": "Job not found"}, status_code=404)
+
+    def _finished(s: Dict[str, Any]) -> bool:
+        return s["status"] not in ("queued", "running")
+
+    async def _stream():
+        current = snapshot
+        yield "retry: 3000\n\n" + _sse_frame("done" if _finished(current) else "progress", current)
+        if _finished(current):
+            return
+        job = _JOBS.get(job_id)
+        if job is not None:
+            queue = _JOBS.subscribe(job_id)
+            try:
+                while not job.finished:
+                    try:
+                        current = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        if await request.is_disconnected():
+                            return
+                        yield ": ping\n\n"
+                        continue
+                    if not _finished(current):
+                        yield _sse_frame("progress", current)
+                yield _sse_frame("done", job.snapshot())
+            finally:
+                _JOBS.unsubscribe(job_id, queue)
+            return
+        # Job de outro worker: acompanhar pela BD
+        while not _finished(current):
+            await asyncio.sleep(JOBS_REMOTE_POLL)
+            if await request.is_disconnected():
+                return
+            rows = await _run_db(_load_job_rows, job_id)
+            if not rows:
+                return
+            if rows[0] != current:
+                current = rows[0]
+                yield _sse_frame("done" if _finished(current) else "progress", current)
+
+    return StreamingResponse(_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no",
+                                      "Content-Encoding": "identity"})
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_background_job(request: Request, job_id: str):
+    require_auth(request)
+    job = _JOBS.get(job_id)
+    if job is not None and not job.finished:
+        _JOBS.cancel(job_id)
+        return _no_store_json({"ok": True, "job": job.snapshot()})
+    if job is None and await _run_db(_request_remote_job_cancel, job_id):
+        return _no_store_json({"ok": True, "job": await _find_job_snapshot(job_id)})
+    snapshot = await _find_job_snapshot(job_id)
+    if snapshot is None:
+        return JSONResponse({"ok": False, "error": "Job not found"}, status_code=404)
+    return JSONResponse({"ok": False, "error": f"Job already {snapshot['status']}", "job": snapshot}, status_code=409)
+
+@app.on_event("shutdown")
+async def shutdown_background_jobs():
+    _JOBS.shutdown()
+
+def _carjet_scrape_dates():
+    """Datas ALEATÓRIAS para scraping (3-10 dias no futuro, 7 dias de aluguer)"""
+    import random
+    days_offset = random.randint(3, 10)
+    start_date = datetime.now() + timedelta(days=days_offset)
+    return start_date, start_date + timedelta(days=7)
+
+async def _refresh_vehicles_job(job: "background_jobs.Job") -> Dict[str, Any]:
+    from carjet_direct import scrape_carjet_direct_async, VEHICLES
+
+    start_date, end_date = _carjet_scrape_dates()
+    print(f"[REFRESH] Usando datas aleatórias: {start_date.strftime('%Y-%m-%d')} a {end_date.strftime('%Y-%m-%d')}")
+
+    locations = ["Albufeira", "Faro"]
+    job.progress(0, len(locations), "Scraping Albufeira + Faro...")
+
+    async def scrape(location: str):
+        results = await scrape_carjet_direct_async(location, start_date, end_date, quick=0)
+        print(f"[REFRESH] {location}: {len(results)} carros encontrados")
+        job.progress(advance=1, message=f"{location}: {len(results)} carros")
+        return results
+
+    # Scraping em Albufeira e Faro em paralelo (SEM quick mode para scraping completo)
+    print("[REFRESH] Fazendo scraping COMPLETO em Albufeira e Faro...")
+    all_results = [item for results in await asyncio.gather(*(scrape(loc) for loc in locations)) for item in results]
+    total_scraped = len(all_results)
+
+    # Carros que não estão no VEHICLES (sem duplicados)
+    unique_new_cars = []
+    seen = set()
+    for item in all_results:
+        car_name = item.get('car', '').strip()
+        if not car_name:
+            continue
+        car_clean = clean_car_name(car_name).lower()
+        if car_clean in VEHICLES or car_clean in seen:
+            continue
+        seen.add(car_clean)
+        unique_new_cars.append({
+            'original_name': car_name,
+            'clean_name': car_clean,
+            'category': item.get('category', ''),
+            'photo_url': item.get('photo', ''),
+            'location': item.get('location', ''),
+            'price': item.get('price', '')
+        })
+
+    message = f"Scraping completo! {total_scraped} carros encontrados, {len(unique_new_cars)} novos."
+    job.progress(message=message)
+    return {
+        "ok": True,
+        "total_scraped": total_scraped,
+        "new_cars_count": len(unique_new_cars),
+        "new_cars": unique_new_cars,
+        "message": message
+    }
+
 @app.post("/api/vehicles/refresh")
 async def refresh_vehicles(request: Request):
     """
     Faz scraping em Albufeira + Faro para verificar carros novos/atualizados
-    Retorna lista de carros novos encontrados
+    Job em background: devolve o job_id; o result do job tem a lista de carros novos
+    (?wait=1 espera e devolve-a diretamente)
     """
     require_auth(request)
+    return await _submit_job(request, "vehicles_refresh", _refresh_vehicles_job, group="carjet_scrape")
+
+def _store_carjet_photo(car_clean: str, photo_data: bytes, photo_url: str):
+    """Grava a foto em vehicle_photos + vehicle_images (uma transação curta por foto)"""
+    updated_at = datetime.now().isoformat()
+    with _db_lock:
+        conn = _db_connect()
+        try:
+            if conn.__class__.__module__ == 'psycopg2.extensions':
+                # PostgreSQL
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO vehicle_photos (vehicle_name, photo_data, photo_url, updated_at)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (vehicle_name) DO UPDATE SET
+                            photo_data = EXCLUDED.photo_data,
+                            photo_url = EXCLUDED.photo_url,
+                            updated_at = EXCLUDED.updated_at
+                    """, (car_clean, photo_data, photo_url, updated_at))
+            else:
+                # SQLite
+                conn.execute("""
+                    INSERT OR REPLACE INTO vehicle_photos (vehicle_name, photo_data, photo_url, updated_at)
+                    VALUES (?, ?, ?, ?)
+                """, (car_clean, photo_data, photo_url, updated_at))
+
+            # Salvar na tabela vehicle_images também
+            conn.execute("""
+                INSERT OR REPLACE INTO vehicle_images (vehicle_name, image_data, image_url, updated_at)
+                VALUES (?, ?, ?, ?)
+            """, (car_clean, photo_data, photo_url, updated_at))
+            conn.commit()
+        finally:
+            conn.close()
+
+async def _download_all_photos_job(job: "background_jobs.Job") -> Dict[str, Any]:
+    from carjet_direct import scrape_carjet_direct_async
+    import httpx
+
+    start_date, end_date = _carjet_scrape_dates()
+    print(f"[DOWNLOAD ALL PHOTOS] Iniciando scraping para {start_date.strftime('%Y-%m-%d')}...", flush=True)
+
+    # Scraping APENAS em Faro (mais rápido e suficiente para fotos)
+    job.progress(message="Scraping Faro...")
+    all_results = await scrape_carjet_direct_async("Faro", start_date, end_date, quick=0)
+    total_cars = len(all_results)
+    print(f"[DOWNLOAD ALL PHOTOS] Faro: {total_cars} carros encontrados", flush=True)
+    job.progress(0, total_cars, f"{total_cars} carros encontrados")
+
+    photos_downloaded = 0
+    photos_failed = 0
     try:
-        from datetime import datetime, timedelta
-        from carjet_direct import scrape_carjet_direct, VEHICLES
-        import random
-        
-        # Datas ALEATÓRIAS para scraping (3-10 dias no futuro)
-        days_offset = random.randint(3, 10)
-        start_date = datetime.now() + timedelta(days=days_offset)
-        end_date = start_date + timedelta(days=7)
-        
-        print(f"[REFRESH] Usando datas aleatórias: {start_date.strftime('%Y-%m-%d')} a {end_date.strftime('%Y-%m-%d')}")
-        
-        new_cars = []
-        updated_cars = []
-        total_scraped = 0
-        
-        # Scraping em Albufeira (SEM quick mode para scraping completo)
-        print("[REFRESH] Fazendo scraping COMPLETO em Albufeira...")
-        albufeira_results = scrape_carjet_direct("Albufeira", start_date, end_date, quick=0)
-        total_scraped += len(albufeira_results)
-        print(f"[REFRESH] Albufeira: {len(albufeira_results)} carros encontrados")
-        
-        # Scraping em Faro (SEM quick mode para scraping completo)
-        print("[REFRESH] Fazendo scraping COMPLETO em Faro...")
-        faro_results = scrape_carjet_direct("Faro", start_date, end_date, quick=0)
-        total_scraped += len(faro_results)
-        print(f"[REFRESH] Faro: {len(faro_results)} carros encontrados")
-        
-        # Combinar resultados
-        all_results = albufeira_results + faro_results
-        
-        # Verificar carros novos
-        for item in all_results:
-            car_name = item.get('car', '').strip()
-            if not car_name:
-                continue
-            
-            car_clean = clean_car_name(car_name).lower()
-            
-            # Verificar se está no VEHICLES
-            if car_clean not in VEHICLES:
-                # Carro novo!
-                category = item.get('category', '')
-                photo_url = item.get('photo', '')
-                
-                new_cars.append({
-                    'original_name': car_name,
-                    'clean_name': car_clean,
-                    'category': category,
-                    'photo_url': photo_url,
-                    'location': item.get('location', ''),
-                    'price': item.get('price', '')
-                })
-        
-        # Remover duplicados
-        seen = set()
-        unique_new_cars = []
-        for car in new_cars:
-            if car['clean_name'] not in seen:
-                seen.add(car['clean_name'])
-                unique_new_cars.append(car)
-        
-        return _no_store_json({
-            "ok": True,
-            "total_scraped": total_scraped,
-            "new_cars_count": len(unique_new_cars),
-            "new_cars": unique_new_cars,
-            "message": f"Scraping completo! {total_scraped} carros encontrados, {len(unique_new_cars)} novos."
-        })
-        
-    except Exception as e:
-        import traceback
-        return _no_store_json({
-            "ok": False,
-            "error": str(e),
-            "traceback": traceback.format_exc()
-        }, 500)
+        # Um cliente para todas as fotos (keep-alive com o CDN); o _db_lock só é usado
+        # em cada gravação, não durante o download
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            for idx, item in enumerate(all_results, 1):
+                car_name = item.get('car', '').strip()
+                photo_url = item.get('photo', '').strip()
+                car_clean = clean_car_name(car_name).lower() if car_name else ''
+
+                if not car_name:
+                    photos_failed += 1
+                    print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] ❌ Sem nome de carro", flush=True)
+                elif not photo_url:
+                    photos_failed += 1
+                    print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] ❌ Sem URL de foto: {car_clean}", flush=True)
+                elif 'loading-car.png' in photo_url:
+                    # IGNORAR placeholders (loading-car.png)
+                    photos_failed += 1
+                    print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] ⏭️  Placeholder ignorado: {car_clean}", flush=True)
+                else:
+                    print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] Baixando foto: {car_clean}", flush=True)
+                    try:
+                        photo_response = await client.get(photo_url)
+                        if photo_response.status_code == 200:
+                            photo_data = photo_response.content
+                            await _run_db(_store_carjet_photo, car_clean, photo_data, photo_url)
+                            photos_downloaded += 1
+                            print(f"[DOWNLOAD ALL PHOTOS] ✅ Foto salva: {car_clean} ({len(photo_data)} bytes)", flush=True)
+                        else:
+                            photos_failed += 1
+                            print(f"[DOWNLOAD ALL PHOTOS] ❌ Erro HTTP {photo_response.status_code}: {car_clean}", flush=True)
+                    except Exception as e:
+                        photos_failed += 1
+                        print(f"[DOWNLOAD ALL PHOTOS] ❌ Erro ao baixar {car_clean}: {e}", flush=True)
+
+                job.progress(idx, message=f"{photos_downloaded} fotos baixadas, {photos_failed} falharam")
+    finally:
+        # também se o job for cancelado a meio: as fotos já gravadas ficam visíveis
+        if photos_downloaded:
+            _vehicle_photos_changed()
+
+    return {
+        "ok": True,
+        "total_cars": total_cars,
+        "photos_downloaded": photos_downloaded,
+        "photos_failed": photos_failed,
+        "message": f"Download completo! {photos_downloaded} fotos baixadas, {photos_failed} falharam."
+    }
 
 @app.post("/api/vehicles/download-all-photos")
 async def download_all_photos_from_carjet(request: Request):
     """
-    Faz scraping em Albufeira + Faro e baixa TODAS as fotos dos carros
-    Mostra progresso em tempo real
+    Faz scraping em Faro e baixa TODAS as fotos dos carros
+    Job em background: progresso por carro em /api/jobs/{id} (?wait=1 espera pelo fim)
+    """
+    require_auth(request)
+    return await _submit_job(request, "vehicles_download_all_photos", _download_all_photos_job, group="carjet_scrape")
+
+@app.post("/api/vehicles/{vehicle_name}/download-photo")
+async def download_vehicle_photo_from_carjet(vehicle_name: str, request: Request):
+    """
+    Baixa a foto do CarJet para um veículo específico e atualiza a ficha
+    Faz scraping rápido para encontrar a foto mais recente
     """
     require_auth(request)
     try:
         from datetime import datetime, timedelta
-        from carjet_direct import scrape_carjet_direct
+        from carjet_direct import scrape_carjet_direct_async
         import httpx
         
-        # Datas aleatórias (hoje + 3 a 10 dias)
-        import random
-        days_offset = random.randint(3, 10)
-        start_date = datetime.now() + timedelta(days=days_offset)
+        # Limpar nome do veículo
+        car_clean = clean_car_name(vehicle_name).lower()
+        
+        # Fazer scraping rápido em Faro para encontrar o carro
+        start_date = datetime.now()
         end_date = start_date + timedelta(days=7)
         
-        print(f"[DOWNLOAD ALL PHOTOS] Iniciando scraping para {start_date.strftime('%Y-%m-%d')}...", flush=True)
+        print(f"[DOWNLOAD PHOTO] Procurando foto para: {car_clean}")
         
-        photos_downloaded = 0
-        photos_failed = 0
-        total_cars = 0
+        # Tentar Faro primeiro
+        results = await scrape_carjet_direct_async("Faro", start_date, end_date, quick=1)
         
-        # Scraping APENAS em Faro (mais rápido e suficiente para fotos)
-        print("[DOWNLOAD ALL PHOTOS] Fazendo scraping COMPLETO em Faro...", flush=True)
-        all_results = scrape_carjet_direct("Faro", start_date, end_date, quick=0)
-        total_cars = len(all_results)
-        print(f"[DOWNLOAD ALL PHOTOS] Faro: {total_cars} carros encontrados", flush=True)
+        # Se não encontrar, tentar Albufeira
+        if not results:
+            results = await scrape_carjet_direct_async("Albufeira", start_date, end_date, quick=1)
         
-        print(f"[DOWNLOAD ALL PHOTOS] Total de carros encontrados: {total_cars}", flush=True)
-        
-        # Baixar fotos
-        with _db_lock:
-            conn = _db_connect()
-            try:
-                for idx, item in enumerate(all_results, 1):
-                    car_name = item.get('car', '').strip()
-                    photo_url = item.get('photo', '').strip()
-                    
-                    if not car_name:
-                        photos_failed += 1
-                        print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] ❌ Sem nome de carro", flush=True)
-                        continue
-                    
-                    car_clean = clean_car_name(car_name).lower()
-                    
-                    if not photo_url:
-                        photos_failed += 1
-                        print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] ❌ Sem URL de foto: {car_clean}", flush=True)
-                        continue
-                    
-                    # IGNORAR placeholders (loading-car.png)
-                    if 'loading-car.png' in photo_url:
-                        photos_failed += 1
-                        print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] ⏭️  Placeholder ignorado: {car_clean}", flush=True)
-                        continue
-                    
-                    print(f"[DOWNLOAD ALL PHOTOS] [{idx}/{total_cars}] Baixando foto: {car_clean}", flush=True)
-                    print(f"                      URL: {photo_url}", flush=True)
-                    
-                    try:
-                        # Baixar foto
-                        async with httpx.AsyncClient(timeout=30.0) as client:
-                            photo_response = await client.get(photo_url)
-                            if photo_response.status_code == 200:
-                                photo_data = photo_response.content
-                                
-                                # Salvar na tabela vehicle_photos
-                                if conn.__class__.__module__ == 'psycopg2.extensions':
-                                    # PostgreSQL
-                                    with conn.cursor() as cur:
-                                        cur.execute("""
-                                            INSERT INTO vehicle_photos (vehicle_name, photo_data, photo_url, updated_at)
-                                            VALUES (%s, %s, %s, %s)
-                                            ON CONFLICT (vehicle_name) DO UPDATE SET
-                                                photo_data = EXCLUDED.photo_data,
-                                                photo_url = EXCLUDED.photo_url,
-                                                updated_at = EXCLUDED.updated_at
-                                        """, (car_clean, photo_data, photo_url, datetime.now().isoformat()))
-                                else:
-                                    # SQLite
-                                    conn.execute("""
-                                        INSERT OR REPLACE INTO vehicle_photos (vehicle_name, photo_data, photo_url, updated_at)
-                                        VALUES (?, ?, ?, ?)
-                                    """, (car_clean, photo_data, photo_url, datetime.now().isoformat()))
-                                
-                                # Salvar na tabela vehicle_images também
-                                conn.execute("""
-                                    INSERT OR REPLACE INTO vehicle_images (vehicle_name, image_data, image_url, updated_at)
-                                    VALUES (?, ?, ?, ?)
-                                """, (car_clean, photo_data, photo_url, datetime.now().isoformat()))
-                                
-                                conn.commit()
-                                photos_downloaded += 1
-                                
-                                print(f"[DOWNLOAD ALL PHOTOS] ✅ Foto salva: {car_clean} ({len(photo_data)} bytes)", flush=True)
-                            else:
-                                photos_failed += 1
-                                print(f"[DOWNLOAD ALL PHOTOS] ❌ Erro HTTP {photo_response.status_code}: {car_clean}", flush=True)
-                    except Exception as e:
-                        photos_failed += 1
-                        print(f"[DOWNLOAD ALL PHOTOS] ❌ Erro ao baixar {car_clean}: {e}", flush=True)
-                        continue
-            finally:
-                conn.close()
-        
-        return _no_store_json({
-            "ok": True,
-            "total_cars": total_cars,
-            "photos_downloaded": photos_downloaded,
-            "photos_failed": photos_failed,
-            "message": f"Download completo! {photos_downloaded} fotos baixadas, {photos_failed} falharam."
-        })
-        
-    except Exception as e:
-        import traceback
-        return _no_store_json({
-            "ok": False,
-            "error": str(e),
-            "traceback": traceback.format_exc()
-        }, 500)
-
-@app.post("/api/vehicles/{vehicle_name}/download-photo")
-async def download_vehicle_photo_from_carjet(vehicle_name: str, request: Request):
-    """
-    Baixa a foto do CarJet para um veículo específico e atualiza a ficha
-    Faz scraping rápido para encontrar a foto mais recente
-    """
-    require_auth(request)
-    try:
-        from datetime import datetime, timedelta
-        from carjet_direct import scrape_carjet_direct
-        import httpx
-        
-        # Limpar nome do veículo
-        car_clean = clean_car_name(vehicle_name).lower()
-        
-        # Fazer scraping rápido em Faro para encontrar o carro
-        start_date = datetime.now()
-        end_date = start_date + timedelta(days=7)
-        
-        print(f"[DOWNLOAD PHOTO] Procurando foto para: {car_clean}")
-        
-        # Tentar Faro primeiro
-        results = scrape_carjet_direct("Faro", start_date, end_date, quick=1)
-        
-        # Se não encontrar, tentar Albufeira
-        if not results:
-            results = scrape_carjet_direct("Albufeira", start_date, end_date, quick=1)
-        
-        # Procurar o carro nos resultados
-        photo_url = None
-        for item in results:
-            car_name = item.get('car', '').strip()
-            if not car_name:
-                continue
-            
-            item_clean = clean_car_name(car_name).lower()
-            
-            if item_clean == car_clean or car_clean in item_clean or item_clean in car_clean:
-                photo_url = item.get('photo', '')
-                if photo_url:
-                    print(f"[DOWNLOAD PHOTO] Foto encontrada: {photo_url}")
-                    break
+        # Procurar o carro nos resultados
+        photo_url = None
+        for item in results:
+            car_name = item.get('car', '').strip()
+            if not car_name:
+                continue
+            
+            item_clean = clean_car_name(car_name).lower()
+            
+            if item_clean == car_clean or car_clean in item_clean or item_clean in car_clean:
+                photo_url = item.get('photo', '')
+                if photo_url:
+                    print(f"[DOWNLOAD PHOTO] Foto encontrada: {photo_url}")
+                    break
         
         if not photo_url:
             return _no_store_json({
@@ -20154,6 +21598,7 @@ async def download_vehicle_photo_from_carjet(vehicle_name: str, request: Request
             finally:
                 conn.close()
         
+        _vehicle_photos_changed()
         return _no_store_json({
             "ok": True,
             "message": f"Foto baixada e salva com sucesso para '{vehicle_name}'!",
@@ -20269,6 +21714,7 @@ async def save_vehicle_name_override(request: Request):
                 con.commit()
             finally:
                 con.close()
+        invalidate_vehicle_classifier()
         
         return _no_store_json({
             "ok": True,
@@ -20290,6 +21736,7 @@ async def delete_vehicle_name_override(original_name: str, request: Request):
                 con.commit()
             finally:
                 con.close()
+        invalidate_vehicle_classifier()
         
         return _no_store_json({
             "ok": True,
@@ -20332,531 +21779,566 @@ async def get_vehicle_name_overrides(request: Request):
 # VEHICLE IMAGES - Download e Storage
 # ============================================================
 
-@app.post("/api/vehicles/images/download")
-async def download_vehicle_images(request: Request):
-    """Download automático de todas as imagens de veículos dos URLs do scraping"""
-    # Não requer autenticação para funcionar em iframes
-    try:
-        from carjet_direct import VEHICLES
-        import httpx
-        import re
-        
-        downloaded = 0
-        skipped = 0
-        errors = []
-        
-        # PRIMEIRO: Buscar URLs de fotos da tabela dedicada car_images
-        photo_urls_from_scraping = {}
+# Pipeline das fotos do VEHICLES (vehicle_photo_fetch): URLs do histórico de scraping
+# (car_images.db) ou de vehicle_photo_fetch.CARJET_IMAGE_URLS, cada URL descarregado
+# uma vez com VEHICLE_IMAGE_CONCURRENCY pedidos em simultâneo. vehicle_photo_sources
+# guarda por veículo o URL, ETag/Last-Modified e sha256 do que foi gravado: nos runs
+# seguintes o pedido é condicional (304 = nada a fazer) e uma foto com o mesmo sha256
+# não é reescrita. Veículos com foto em vehicle_images (que é a servida primeiro) não
+# recebem cópia em vehicle_photos.
+VEHICLE_IMAGE_CONCURRENCY = max(1, int(os.getenv("VEHICLE_IMAGE_CONCURRENCY", "8") or 8))
+VEHICLE_IMAGE_WRITE_BATCH = 25  # fotos por transação (o _db_lock é largado entre lotes)
+VEHICLE_PHOTO_SOURCES_DDL = """
+    CREATE TABLE IF NOT EXISTS vehicle_photo_sources (
+      vehicle_name TEXT PRIMARY KEY,
+      photo_url TEXT NOT NULL,
+      etag TEXT,
+      last_modified TEXT,
+      content_hash TEXT,
+      checked_at TEXT
+    );
+"""
+_vehicle_photo_sources_ready = False
+
+def _ensure_vehicle_photo_sources_table():
+    global _vehicle_photo_sources_ready
+    if _vehicle_photo_sources_ready:
+        return
+    with _db_lock:
+        con = _db_connect()
         try:
-            # Usar car_images.db (DB dedicada de fotos)
-            from pathlib import Path
-            car_images_db = str(Path(__file__).resolve().parent / "car_images.db")
-            
-            if os.path.exists(car_images_db):
-                with _db_lock:
-                    conn = sqlite3.connect(car_images_db)
-                    try:
-                        # Buscar fotos do car_images (tabela dedicada de fotos)
-                        query = """
-                            SELECT DISTINCT model_key, photo_url 
-                            FROM car_images 
-                            WHERE photo_url IS NOT NULL
-                            AND photo_url != ''
-                        """
-                        rows = conn.execute(query).fetchall()
-                        
-                        for row in rows:
-                            model_key = row[0]
-                            photo_url = row[1]
-                            
-                            # Limpar nome para encontrar no VEHICLES
-                            clean = model_key.lower().strip()
-                            clean = re.sub(r'\s+(ou\s*similar|or\s*similar).*$', '', clean, flags=re.IGNORECASE)
-                            clean = re.sub(r'\s*\|\s*.*$', '', clean)
-                            clean = re.sub(r'\s+(pequeno|médio|medio|grande|compacto|economico|econômico).*$', '', clean, flags=re.IGNORECASE)
-                            clean = re.sub(r'\s+', ' ', clean).strip()
-                            
-                            if clean in VEHICLES and clean not in photo_urls_from_scraping:
-                                photo_urls_from_scraping[clean] = photo_url
-                                
-                    finally:
-                        conn.close()
-        except Exception as e:
-            print(f"[PHOTOS] Erro ao buscar fotos do car_images.db: {e}", file=sys.stderr, flush=True)
-        
-        print(f"[PHOTOS] Encontradas {len(photo_urls_from_scraping)} fotos no histórico de scraping", file=sys.stderr, flush=True)
-        
-        # SEGUNDO: Mapeamento manual para veículos sem dados recentes
-        image_mappings = {
-            # MINI / B1 / B2
-            'fiat 500 cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L154.jpg',
-            'fiat 500': 'https://www.carjet.com/cdn/img/cars/M/car_C25.jpg',
-            'fiat 500x': 'https://www.carjet.com/cdn/img/cars/M/car_A112.jpg',
-            'fiat 500x auto': 'https://www.carjet.com/cdn/img/cars/M/car_A112.jpg',
-            'fiat 500l': 'https://www.carjet.com/cdn/img/cars/M/car_C43.jpg',
-            'fiat panda': 'https://www.carjet.com/cdn/img/cars/M/car_C30.jpg',
-            'citroen c1': 'https://www.carjet.com/cdn/img/cars/M/car_C96.jpg',
-            'citroën c1': 'https://www.carjet.com/cdn/img/cars/M/car_C96.jpg',
-            'toyota aygo': 'https://www.carjet.com/cdn/img/cars/M/car_C29.jpg',
-            'toyota aygo x': 'https://www.carjet.com/cdn/img/cars/M/car_F408.jpg',
-            'volkswagen up': 'https://www.carjet.com/cdn/img/cars/M/car_C66.jpg',
-            'vw up': 'https://www.carjet.com/cdn/img/cars/M/car_C66.jpg',
-            'peugeot 108': 'https://www.carjet.com/cdn/img/cars/M/car_C15.jpg',
-            'peugeot 108 cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L41.jpg',
-            'hyundai i10': 'https://www.carjet.com/cdn/img/cars/M/car_C32.jpg',
-            'kia picanto': 'https://www.carjet.com/cdn/img/cars/M/car_C59.jpg',
-            'opel adam': 'https://www.carjet.com/cdn/img/cars/M/car_C50.jpg',
-            'mitsubishi space star': 'https://www.carjet.com/cdn/img/cars/M/car_C190.jpg',
-            'mitsubishi spacestar': 'https://www.carjet.com/cdn/img/cars/M/car_C190.jpg',
-            'nissan micra': 'https://www.carjet.com/cdn/img/cars/M/car_C13.jpg',
-            'renault twingo': 'https://www.carjet.com/cdn/img/cars/M/car_C61.jpg',
-            'dacia sandero': 'https://www.carjet.com/cdn/img/cars/M/car_C75.jpg',
-            'skoda scala': 'https://www.carjet.com/cdn/img/cars/M/car_C166.jpg',
-            
-            # ECONOMY / D / E2
-            'renault clio': 'https://www.carjet.com/cdn/img/cars/M/car_C04.jpg',
-            'renault clio sw': 'https://www.carjet.com/cdn/img/cars/M/car_C54.jpg',
-            'peugeot 208': 'https://www.carjet.com/cdn/img/cars/M/car_C60.jpg',
-            'ford fiesta': 'https://www.carjet.com/cdn/img/cars/M/car_C17.jpg',
-            'ford ka': 'https://www.carjet.com/cdn/img/cars/M/car_N07.jpg',
-            'volkswagen polo': 'https://www.carjet.com/cdn/img/cars/M/car_C27.jpg',
-            'vw polo': 'https://www.carjet.com/cdn/img/cars/M/car_C27.jpg',
-            'hyundai i20': 'https://www.carjet.com/cdn/img/cars/M/car_C52.jpg',
-            'seat ibiza': 'https://www.carjet.com/cdn/img/cars/M/car_C01.jpg',
-            'seat ibiza auto': 'https://www.carjet.com/cdn/img/cars/M/car_C01.jpg',
-            'citroen c3': 'https://www.carjet.com/cdn/img/cars/M/car_C06.jpg',
-            'citroën c3': 'https://www.carjet.com/cdn/img/cars/M/car_C06.jpg',
-            'citroen c4 cactus': 'https://www.carjet.com/cdn/img/cars/M/car_C51.jpg',
-            'citroën c4 cactus': 'https://www.carjet.com/cdn/img/cars/M/car_C51.jpg',
-            'opel corsa': 'https://www.carjet.com/cdn/img/cars/M/car_A03.jpg',
-            'opel corsa auto': 'https://www.carjet.com/cdn/img/cars/M/car_A03.jpg',
-            'toyota yaris': 'https://www.carjet.com/cdn/img/cars/M/car_C64.jpg',
-            
-            # COMPACT / F
-            'volkswagen golf': 'https://www.carjet.com/cdn/img/cars/M/car_F12.jpg',
-            'vw golf': 'https://www.carjet.com/cdn/img/cars/M/car_F12.jpg',
-            'audi a1': 'https://www.carjet.com/cdn/img/cars/M/car_C42.jpg',
-            'ford focus': 'https://www.carjet.com/cdn/img/cars/M/car_F02.jpg',
-            'renault megane': 'https://www.carjet.com/cdn/img/cars/M/car_F05.jpg',
-            'renault mégane': 'https://www.carjet.com/cdn/img/cars/M/car_F05.jpg',
-            'peugeot 308': 'https://www.carjet.com/cdn/img/cars/M/car_F22.jpg',
-            'hyundai i30': 'https://www.carjet.com/cdn/img/cars/M/car_C41.jpg',
-            'kia ceed': 'https://www.carjet.com/cdn/img/cars/M/car_C21.jpg',
-            'kia ceed auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1023.jpg',
-            'seat leon': 'https://www.carjet.com/cdn/img/cars/M/car_F39.jpg',
-            'seat león': 'https://www.carjet.com/cdn/img/cars/M/car_F39.jpg',
-            'toyota corolla auto': 'https://www.carjet.com/cdn/img/cars/M/car_A623.jpg',
-            'opel astra': 'https://www.carjet.com/cdn/img/cars/M/car_F73.jpg',
-            'citroen c4': 'https://www.carjet.com/cdn/img/cars/M/car_A17.jpg',
-            'citroën c4': 'https://www.carjet.com/cdn/img/cars/M/car_A17.jpg',
-            'peugeot 508': 'https://www.carjet.com/cdn/img/cars/M/car_F65.jpg',
-            
-            # SUV / F / L1
-            'nissan juke': 'https://www.carjet.com/cdn/img/cars/M/car_F29.jpg',
-            'peugeot 2008': 'https://www.carjet.com/cdn/img/cars/M/car_F91.jpg',
-            'peugeot 3008': 'https://www.carjet.com/cdn/img/cars/M/car_A132.jpg',
-            'peugeot 3008 auto': 'https://www.carjet.com/cdn/img/cars/M/car_A132.jpg',
-            'renault captur': 'https://www.carjet.com/cdn/img/cars/M/car_F44.jpg',
-            'volkswagen t-cross': 'https://www.carjet.com/cdn/img/cars/M/car_F252.jpg',
-            'vw t-cross': 'https://www.carjet.com/cdn/img/cars/M/car_F252.jpg',
-            'volkswagen tcross': 'https://www.carjet.com/cdn/img/cars/M/car_F252.jpg',
-            'ford kuga': 'https://www.carjet.com/cdn/img/cars/M/car_F41.jpg',
-            'kia stonic': 'https://www.carjet.com/cdn/img/cars/M/car_F119.jpg',
-            'citroen c3 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A782.jpg',
-            'citroën c3 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A782.jpg',
-            'citroen c5 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
-            'citroën c5 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
-            'citroen c5 aircross auto': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
-            'citroën c5 aircross auto': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
-            'jeep avenger': 'https://www.carjet.com/cdn/img/cars/M/car_L164.jpg',
-            'jeep renegade': 'https://www.carjet.com/cdn/img/cars/M/car_A222.jpg',
-            'jeep renegade auto': 'https://www.carjet.com/cdn/img/cars/M/car_A222.jpg',
-            'volkswagen taigo': 'https://www.carjet.com/cdn/img/cars/M/car_F352.jpg',
-            'vw taigo': 'https://www.carjet.com/cdn/img/cars/M/car_F352.jpg',
-            'hyundai kauai': 'https://www.carjet.com/cdn/img/cars/M/car_F44.jpg',
-            'hyundai kauaí': 'https://www.carjet.com/cdn/img/cars/M/car_F44.jpg',
-            'mitsubishi asx': 'https://www.carjet.com/cdn/img/cars/M/car_F178.jpg',
-            'hyundai kona': 'https://www.carjet.com/cdn/img/cars/M/car_F191.jpg',
-            'toyota c-hr': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
-            'toyota chr': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
-            'toyota c-hr auto': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
-            'toyota chr auto': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
-            'ford ecosport': 'https://www.carjet.com/cdn/img/cars/M/car_A606.jpg',
-            'ford eco sport': 'https://www.carjet.com/cdn/img/cars/M/car_A606.jpg',
-            'ford ecosport auto': 'https://www.carjet.com/cdn/img/cars/M/car_A606.jpg',
-            'opel crossland x': 'https://www.carjet.com/cdn/img/cars/M/car_A444.jpg',
-            'opel crossland x auto': 'https://www.carjet.com/cdn/img/cars/M/car_A444.jpg',
-            'volkswagen tiguan': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
-            'vw tiguan': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
-            'volkswagen tiguan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
-            'vw tiguan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
-            'skoda karoq': 'https://www.carjet.com/cdn/img/cars/M/car_A822.jpg',
-            'skoda karoq auto': 'https://www.carjet.com/cdn/img/cars/M/car_A822.jpg',
-            'kia sportage': 'https://www.carjet.com/cdn/img/cars/M/car_F43.jpg',
-            'nissan qashqai': 'https://www.carjet.com/cdn/img/cars/M/car_F24.jpg',
-            'skoda kamiq': 'https://www.carjet.com/cdn/img/cars/M/car_F310.jpg',
-            'hyundai tucson': 'https://www.carjet.com/cdn/img/cars/M/car_F310.jpg',
-            'renault austral': 'https://www.carjet.com/cdn/img/cars/M/car_F430.jpg',
-            'seat ateca': 'https://www.carjet.com/cdn/img/cars/M/car_F154.jpg',
-            'seat arona': 'https://www.carjet.com/cdn/img/cars/M/car_F194.jpg',
-            'seat arona auto': 'https://www.carjet.com/cdn/img/cars/M/car_F194.jpg',
-            'ford puma': 'https://www.carjet.com/cdn/img/cars/M/car_A999.jpg',
-            'ford puma auto': 'https://www.carjet.com/cdn/img/cars/M/car_A999.jpg',
-            'mazda cx-3': 'https://www.carjet.com/cdn/img/cars/M/car_F179.jpg',
-            'mazda cx 3': 'https://www.carjet.com/cdn/img/cars/M/car_F179.jpg',
-            'renault arkana': 'https://www.carjet.com/cdn/img/cars/M/car_A1159.jpg',
-            'renault arkana auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1159.jpg',
-            'toyota rav 4': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
-            'toyota rav4': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
-            'toyota rav 4 4x4': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
-            'toyota rav 4 auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
-            'toyota hilux': 'https://www.carjet.com/cdn/img/cars/M/car_F326.jpg',
-            'toyota hilux 4x4': 'https://www.carjet.com/cdn/img/cars/M/car_F326.jpg',
-            
-            # PREMIUM / G
-            'mini cooper countryman': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
-            'miny cooper countryman': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
-            'mini countryman': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
-            'mini cooper countryman auto': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
-            'mini cooper cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L118.jpg',
-            'mini one cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L118.jpg',
-            'volkswagen beetle cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L44.jpg',
-            'vw beetle cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L44.jpg',
-            'cupra formentor': 'https://www.carjet.com/cdn/img/cars/M/car_A1185.jpg',
-            'cupra formentor auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1185.jpg',
-            'ds 4': 'https://www.carjet.com/cdn/img/cars/M/car_A1637.jpg',
-            'ds 4 auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1637.jpg',
-            
-            # STATION WAGON / J2 / L2
-            'peugeot 308 sw': 'https://www.carjet.com/cdn/img/cars/M/car_S06.jpg',
-            'peugeot 308 sw auto': 'https://www.carjet.com/cdn/img/cars/M/car_S06.jpg',
-            'opel astra sw': 'https://www.carjet.com/cdn/img/cars/M/car_S10.jpg',
-            'cupra leon sw': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
-            'cupra leon st': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
-            'cupra leon estate': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
-            'cupra leon sport tourer': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
-            'cupra leon sw auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
-            'toyota corolla sw': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
-            'toyota corolla touring sports': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
-            'toyota corolla estate': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
-            'toyota corolla sw auto': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
-            'skoda octavia': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
-            'skoda octavia sw': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
-            'skoda octavia combi': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
-            'skoda octavia estate': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
-            'skoda fabia sw': 'https://www.carjet.com/cdn/img/cars/M/car_S34.jpg',
-            'skoda fabia combi': 'https://www.carjet.com/cdn/img/cars/M/car_S34.jpg',
-            'skoda fabia estate': 'https://www.carjet.com/cdn/img/cars/M/car_S34.jpg',
-            'volkswagen passat': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
-            'vw passat': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
-            'volkswagen passat variant': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
-            'volkswagen passat estate': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
-            'volkswagen passat sw': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
-            'fiat tipo sw': 'https://www.carjet.com/cdn/img/cars/M/car_F72.jpg',
-            'fiat tipo estate': 'https://www.carjet.com/cdn/img/cars/M/car_F72.jpg',
-            'seat leon sw': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
-            'seat leon st': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
-            'seat leon estate': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
-            'seat leon sport tourer': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
-            
-            # 7 SEATER / M1 / M2
-            'dacia lodgy': 'https://www.carjet.com/cdn/img/cars/M/car_M117.jpg',
-            'dacia jogger': 'https://www.carjet.com/cdn/img/cars/M/car_M162.jpg',
-            'opel zafira': 'https://www.carjet.com/cdn/img/cars/M/car_M05.jpg',
-            'peugeot 5008': 'https://www.carjet.com/cdn/img/cars/M/car_M27.jpg',
-            'renault grand scenic': 'https://www.carjet.com/cdn/img/cars/M/car_M15.jpg',
-            'renault grand scenic auto': 'https://www.carjet.com/cdn/img/cars/M/car_M15.jpg',
-            'citroen grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
-            'citroën grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
-            'citroen c4 grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
-            'citroën c4 grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
-            'citroen c4 grand picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
-            'citroën c4 grand picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
-            'citroen c4 picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A522.jpg',
-            'citroën c4 picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A522.jpg',
-            'citroen c4 grand spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A1430.jpg',
-            'citroën c4 grand spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A1430.jpg',
-            'citroen c4 grand spacetourer auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1430.jpg',
-            'volkswagen caddy': 'https://www.carjet.com/cdn/img/cars/M/car_A295.jpg',
-            'vw caddy': 'https://www.carjet.com/cdn/img/cars/M/car_A295.jpg',
-            'volkswagen caddy auto': 'https://www.carjet.com/cdn/img/cars/M/car_A295.jpg',
-            'peugeot rifter': 'https://www.carjet.com/cdn/img/cars/M/car_M124.jpg',
-            'peugeot rifter auto': 'https://www.carjet.com/cdn/img/cars/M/car_M124.jpg',
-            'mercedes glb': 'https://www.carjet.com/cdn/img/cars/M/car_GZ399.jpg',
-            'mercedes glb auto': 'https://www.carjet.com/cdn/img/cars/M/car_GZ399.jpg',
-            
-            # 9 SEATER / N
-            'ford tourneo': 'https://www.carjet.com/cdn/img/cars/M/car_M44.jpg',
-            'ford transit': 'https://www.carjet.com/cdn/img/cars/M/car_M02.jpg',
-            'ford galaxy': 'https://www.carjet.com/cdn/img/cars/M/car_M03.jpg',
-            'volkswagen sharan': 'https://www.carjet.com/cdn/img/cars/M/car_M56.jpg',
-            'vw sharan': 'https://www.carjet.com/cdn/img/cars/M/car_M56.jpg',
-            'volkswagen multivan': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
-            'vw multivan': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
-            'volkswagen multivan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
-            'vw multivan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
-            'citroen spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A261.jpg',
-            'citroën spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A261.jpg',
-            'citroen spacetourer auto': 'https://www.carjet.com/cdn/img/cars/M/car_A261.jpg',
-            'renault trafic': 'https://www.carjet.com/cdn/img/cars/M/car_A581.jpg',
-            'renault trafic auto': 'https://www.carjet.com/cdn/img/cars/M/car_A581.jpg',
-            'peugeot traveller': 'https://www.carjet.com/cdn/img/cars/M/car_M86.jpg',
-            'volkswagen transporter': 'https://www.carjet.com/cdn/img/cars/M/car_M08.jpg',
-            'vw transporter': 'https://www.carjet.com/cdn/img/cars/M/car_M08.jpg',
-            'mercedes vito': 'https://www.carjet.com/cdn/img/cars/M/car_A230.jpg',
-            'mercedes benz vito': 'https://www.carjet.com/cdn/img/cars/M/car_A230.jpg',
-            'mercedes vito auto': 'https://www.carjet.com/cdn/img/cars/M/car_A230.jpg',
-            'volkswagen caravelle': 'https://www.carjet.com/cdn/img/cars/M/car_M63.jpg',
-            'vw caravelle': 'https://www.carjet.com/cdn/img/cars/M/car_M63.jpg',
-            'mercedes v class': 'https://www.carjet.com/cdn/img/cars/M/car_A1336.jpg',
-            'mercedes benz v class': 'https://www.carjet.com/cdn/img/cars/M/car_A1336.jpg',
-            'mercedes v class auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1336.jpg',
-            'fiat talento': 'https://www.carjet.com/cdn/img/cars/M/car_M49.jpg',
-            'opel vivaro': 'https://www.carjet.com/cdn/img/cars/M/car_M34.jpg',
-            'toyota proace': 'https://www.carjet.com/cdn/img/cars/M/car_M136.jpg',
-        }
-        
-        for vehicle_key in VEHICLES.keys():
+            con.execute(VEHICLE_PHOTO_SOURCES_DDL)
+            con.commit()
+            _vehicle_photo_sources_ready = True
+        finally:
+            con.close()
+
+def _car_images_photo_urls(vehicles) -> Dict[str, str]:
+    """Fotos do histórico de scraping (car_images.db) por chave do VEHICLES"""
+    photo_urls_from_scraping = {}
+    try:
+        # Usar car_images.db (DB dedicada de fotos)
+        car_images_db = str(Path(__file__).resolve().parent / "car_images.db")
+
+        if os.path.exists(car_images_db):
+            conn = sqlite3.connect(car_images_db)
             try:
-                # Verificar se já existe
-                with _db_lock:
-                    con = _db_connect()
-                    try:
-                        existing = con.execute("SELECT vehicle_name FROM vehicle_photos WHERE vehicle_name = ?", (vehicle_key,)).fetchone()
-                        if existing:
-                            skipped += 1
-                            continue
-                    finally:
-                        con.close()
-                
-                # Buscar URL da imagem - PRIORIDADE: scraping recente
-                image_url = photo_urls_from_scraping.get(vehicle_key) or image_mappings.get(vehicle_key)
-                if not image_url:
-                    errors.append(f"{vehicle_key}: No photo URL found")
-                    continue
-                
-                print(f"[PHOTOS] Downloading {vehicle_key} from {image_url[:80]}...", file=sys.stderr, flush=True)
-                
-                # Download da imagem
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.get(image_url)
-                    if response.status_code == 200:
-                        image_data = response.content
-                        content_type = response.headers.get('content-type', 'image/jpeg')
-                        
-                        # Salvar na BD
-                        with _db_lock:
-                            con = _db_connect()
-                            try:
-                                if con.__class__.__module__ == 'psycopg2.extensions':
-                                    # PostgreSQL
-                                    with con.cursor() as cur:
-                                        cur.execute("""
-                                            INSERT INTO vehicle_photos (vehicle_name, photo_data, content_type, photo_url)
-                                            VALUES (%s, %s, %s, %s)
-                                            ON CONFLICT (vehicle_name) DO UPDATE SET
-                                                photo_data = EXCLUDED.photo_data,
-                                                content_type = EXCLUDED.content_type,
-                                                photo_url = EXCLUDED.photo_url
-                                        """, (vehicle_key, image_data, content_type, image_url))
-                                else:
-                                    # SQLite
-                                    con.execute("""
-                                        INSERT OR REPLACE INTO vehicle_photos (vehicle_name, photo_data, content_type, photo_url)
-                                        VALUES (?, ?, ?, ?)
-                                    """, (vehicle_key, image_data, content_type, image_url))
-                                con.commit()
-                                downloaded += 1
-                            finally:
-                                con.close()
-            except Exception as e:
-                errors.append(f"{vehicle_key}: {str(e)}")
-        
-        return _no_store_json({
-            "ok": True,
-            "downloaded": downloaded,
-            "skipped": skipped,
-            "errors": errors[:10]
-        })
+                # Buscar fotos do car_images (tabela dedicada de fotos)
+                rows = conn.execute("""
+                    SELECT DISTINCT model_key, photo_url
+                    FROM car_images
+                    WHERE photo_url IS NOT NULL
+                    AND photo_url != ''
+                """).fetchall()
+            finally:
+                conn.close()
+
+            cleaned: Dict[str, str] = {}  # muitas linhas repetem o mesmo model_key
+            for model_key, photo_url in rows:
+                clean = cleaned.get(model_key)
+                if clean is None:
+                    clean = cleaned[model_key] = vehicle_photo_fetch.clean_model_key(model_key)
+                if clean in vehicles and clean not in photo_urls_from_scraping:
+                    photo_urls_from_scraping[clean] = photo_url
     except Exception as e:
-        import traceback
-        return _no_store_json({"ok": False, "error": str(e), "traceback": traceback.format_exc()}, 500)
+        print(f"[PHOTOS] Erro ao buscar fotos do car_images.db: {e}", file=sys.stderr, flush=True)
+    return photo_urls_from_scraping
 
-@app.get("/api/vehicles/{vehicle_name}/photo")
-async def get_vehicle_photo(vehicle_name: str):
-    """Retorna a foto de um veículo específico"""
-    # Não requer autenticação para permitir que as tags <img> funcionem
-    from fastapi.responses import Response
-    
-    try:
-        # Normalizar nome do veículo
-        vehicle_key = vehicle_name.lower().strip()
-        
+def _vehicle_image_state():
+    """(chaves em vehicle_images, chaves em vehicle_photos, vehicle_photo_sources por veículo)"""
+    _ensure_vehicle_photo_sources_table()
+    with _db_lock:
+        con = _db_connect()
+        try:
+            image_keys = {r[0] for r in con.execute("SELECT vehicle_key FROM vehicle_images").fetchall()}
+            photo_keys = {r[0] for r in con.execute("SELECT vehicle_name FROM vehicle_photos").fetchall()}
+            sources = {
+                r[0]: {"url": r[1], "etag": r[2], "last_modified": r[3], "hash": r[4]}
+                for r in con.execute(
+                    "SELECT vehicle_name, photo_url, etag, last_modified, content_hash FROM vehicle_photo_sources"
+                ).fetchall()
+            }
+        finally:
+            con.close()
+    return image_keys, photo_keys, sources
+
+def _stored_vehicle_photo_hashes(names: List[str]) -> Dict[str, str]:
+    """sha256 das fotos já em vehicle_photos (fotos antigas, sem vehicle_photo_sources)"""
+    hashes = {}
+    for i in range(0, len(names), VEHICLE_IMAGE_WRITE_BATCH):
+        chunk = names[i:i + VEHICLE_IMAGE_WRITE_BATCH]
         with _db_lock:
             con = _db_connect()
             try:
-                row = None
-                
-                # PostgreSQL or SQLite
-                if con.__class__.__module__ == 'psycopg2.extensions':
-                    # PostgreSQL - usar cursor
-                    cursor = con.cursor()
-                    
-                    # Tentar buscar foto exata em vehicle_images primeiro
-                    cursor.execute(
-                        "SELECT image_data, content_type FROM vehicle_images WHERE vehicle_key = %s",
-                        (vehicle_key,)
-                    )
-                    row = cursor.fetchone()
-                    
-                    # Se não encontrar, tentar em vehicle_photos
-                    if not row:
-                        cursor.execute(
-                            "SELECT photo_data, content_type FROM vehicle_photos WHERE vehicle_name = %s",
-                            (vehicle_key,)
-                        )
-                        row = cursor.fetchone()
-                    
-                    # Se não encontrar, tentar buscar variações do mesmo modelo
-                    if not row:
-                        # Detectar se é Station Wagon (SW) - são modelos diferentes!
-                        is_sw = ' sw' in vehicle_key or 'station wagon' in vehicle_key or 'estate' in vehicle_key
-                        
-                        # Extrair modelo base (ex: "citroen c1" de "citroen c1 auto")
-                        base_model = vehicle_key
-                        for suffix in [' auto', ' automatic', ' hybrid', ' electric', ' diesel', ' 4x4', ', hybrid', ', electric', ', diesel', ', automatic']:
-                            base_model = base_model.replace(suffix, '')
-                        base_model = base_model.strip()
-                        
-                        search_pattern = base_model + '%'
-                        
-                        if is_sw:
-                            cursor.execute(
-                                "SELECT image_data, content_type FROM vehicle_images WHERE vehicle_key LIKE %s AND (vehicle_key LIKE %s OR vehicle_key LIKE %s OR vehicle_key LIKE %s) LIMIT 1",
-                                (search_pattern, '%sw%', '%station wagon%', '%estate%')
-                            )
-                            row = cursor.fetchone()
-                        else:
-                            cursor.execute(
-                                "SELECT image_data, content_type FROM vehicle_images WHERE vehicle_key LIKE %s AND vehicle_key NOT LIKE %s AND vehicle_key NOT LIKE %s AND vehicle_key NOT LIKE %s LIMIT 1",
-                                (search_pattern, '%sw%', '%station wagon%', '%estate%')
-                            )
-                            row = cursor.fetchone()
-                    
-                    cursor.close()
-                else:
-                    # SQLite - usar execute direto
-                    # Tentar buscar foto exata em vehicle_images primeiro
-                    row = con.execute(
-                        "SELECT image_data, content_type FROM vehicle_images WHERE vehicle_key = ?",
-                        (vehicle_key,)
-                    ).fetchone()
-                    
-                    # Se não encontrar, tentar em vehicle_photos
-                    if not row:
-                        row = con.execute(
-                            "SELECT photo_data, content_type FROM vehicle_photos WHERE vehicle_name = ?",
-                            (vehicle_key,)
-                        ).fetchone()
-                    
-                    # Se não encontrar, tentar buscar variações do mesmo modelo
-                    if not row:
-                        is_sw = ' sw' in vehicle_key or 'station wagon' in vehicle_key or 'estate' in vehicle_key
-                        base_model = vehicle_key
-                        for suffix in [' auto', ' automatic', ' hybrid', ' electric', ' diesel', ' 4x4', ', hybrid', ', electric', ', diesel', ', automatic']:
-                            base_model = base_model.replace(suffix, '')
-                        base_model = base_model.strip()
-                        
-                        search_pattern = base_model + '%'
-                        
-                        if is_sw:
-                            row = con.execute(
-                                "SELECT image_data, content_type FROM vehicle_images WHERE vehicle_key LIKE ? AND (vehicle_key LIKE ? OR vehicle_key LIKE ? OR vehicle_key LIKE ?) LIMIT 1",
-                                (search_pattern, '%sw%', '%station wagon%', '%estate%')
-                            ).fetchone()
-                        else:
-                            row = con.execute(
-                                "SELECT image_data, content_type FROM vehicle_images WHERE vehicle_key LIKE ? AND vehicle_key NOT LIKE ? AND vehicle_key NOT LIKE ? AND vehicle_key NOT LIKE ? LIMIT 1",
-                                (search_pattern, '%sw%', '%station wagon%', '%estate%')
-                            ).fetchone()
-                
-                if row:
-                    image_data = row[0]
-                    content_type = row[1] or 'image/jpeg'
-                    
-                    # Convert memoryview to bytes (PostgreSQL compatibility)
-                    if isinstance(image_data, memoryview):
-                        image_data = bytes(image_data)
-                    
-                    return Response(
-                        content=image_data,
-                        media_type=content_type,
-                        headers={
-                            "Cache-Control": "public, max-age=86400",
-                            "Content-Disposition": f"inline; filename={vehicle_key}.jpg"
-                        }
-                    )
-                else:
-                    # Retornar imagem placeholder JPG - IMAGEM REAL (placeholder.jpg)
-                    import base64
-                    placeholder_base64 = "iVBORw0KGgoAAAANSUhEUgAAAPAAAACgAgMAAABPtQn2AAAADFBMVEX////s7Oz29vbw8PCPhvoMAAACV0lEQVRo3u2Yv27bMBCHLRkaVMOjH0FA0aDo5N2P4MEnahBSPYJGj0L6DN49Fu7gqWMBoe+g3WPQvUsQRLFDxReYxxP/rPyWBPjpE0XyRPs8CQQCgUAgEAioxIdfff/UuKhf/oDk0V79D1e2lg98RNV27E9yWGRv7t51cMO98bA9StbTzoBAGG7YAsB96B2QND7y1lR2n3UHNJWBG4GG3GGnkNZ+ykgx6k5BixiV54BYL9mSkcsxGTga+41CKucpj693xsrC5H10q5OvwFM4vBTISe/GMIbYM7XpYUdgwKObzB9IKXjYKPOcfGTR8JXNs/WRhb3Mv5yJsVz6yMJHhsZHXvHnCE/tI5c+cu4jA/NxMU7Ln508K0p2LtCdjwwW1LT87/Bbq2C2Jo/t7fmfTtVus4KUG+3HjswyusSm8o53L02sepgxcjUDuKfWHTO93FxW5JTQJYkZKefxWxJR7uYtKyKtXKSXRMTklOeYkXItF7OlJl0tZdZJWd2qlbRqpcwxqxY6uRmeUHm1MVtnUlbLczqsjXL+Y1YmpNyBGJY5T1U3T/EvIe+uF4iI2Kk5ZoS8gE2Cj3gDZrScXeYjeVDlMgPJD1JO8IK/ios78EDKERTWMsLLS8woeXm9oB2TC0WelcYjrycKn43nXE1UjLeqZeRLC3840/d9RxVJzjUZE+T9Ps9DJlLdl8CI6TrTIYuP/U/uK/eGvjFmNEwzEWPGdrE104LUY83kisnasZ6OybjOLGb61SlmzKQrNmOYMb8tpDJj+PZ9r82O5ywQCAQCgUAg8IFXa6Syf/OCFmoAAAAASUVORK5CYII="
-                    placeholder_bytes = base64.b64decode(placeholder_base64)
-                    return Response(
-                        content=placeholder_bytes,
-                        media_type="image/jpeg"
-                    )
+                rows = con.execute(
+                    f"SELECT vehicle_name, photo_data FROM vehicle_photos WHERE vehicle_name IN ({','.join('?' * len(chunk))})",
+                    tuple(chunk)
+                ).fetchall()
             finally:
                 con.close()
-    except Exception as e:
-        import traceback
-        import logging
-        error_details = traceback.format_exc()
-        logging.error(f"❌ [PHOTO-ERROR] Vehicle: {vehicle_name}, Error: {str(e)}")
-        logging.error(f"❌ [PHOTO-ERROR] Traceback:\n{error_details}")
-        
-        # Retornar placeholder JPG em caso de erro - IMAGEM REAL (placeholder.jpg)
-        import base64
-        placeholder_base64 = "iVBORw0KGgoAAAANSUhEUgAAAPAAAACgAgMAAABPtQn2AAAADFBMVEX////s7Oz29vbw8PCPhvoMAAACV0lEQVRo3u2Yv27bMBCHLRkaVMOjH0FA0aDo5N2P4MEnahBSPYJGj0L6DN49Fu7gqWMBoe+g3WPQvUsQRLFDxReYxxP/rPyWBPjpE0XyRPs8CQQCgUAgEAioxIdfff/UuKhf/oDk0V79D1e2lg98RNV27E9yWGRv7t51cMO98bA9StbTzoBAGG7YAsB96B2QND7y1lR2n3UHNJWBG4GG3GGnkNZ+ykgx6k5BixiV54BYL9mSkcsxGTga+41CKucpj693xsrC5H10q5OvwFM4vBTISe/GMIbYM7XpYUdgwKObzB9IKXjYKPOcfGTR8JXNs/WRhb3Mv5yJsVz6yMJHhsZHXvHnCE/tI5c+cu4jA/NxMU7Ln508K0p2LtCdjwwW1LT87/Bbq2C2Jo/t7fmfTtVus4KUG+3HjswyusSm8o53L02sepgxcjUDuKfWHTO93FxW5JTQJYkZKefxWxJR7uYtKyKtXKSXRMTklOeYkXItF7OlJl0tZdZJWd2qlbRqpcwxqxY6uRmeUHm1MVtnUlbLczqsjXL+Y1YmpNyBGJY5T1U3T/EvIe+uF4iI2Kk5ZoS8gE2Cj3gDZrScXeYjeVDlMgPJD1JO8IK/ios78EDKERTWMsLLS8woeXm9oB2TC0WelcYjrycKn43nXE1UjLeqZeRLC3840/d9RxVJzjUZE+T9Ps9DJlLdl8CI6TrTIYuP/U/uK/eGvjFmNEwzEWPGdrE104LUY83kisnasZ6OybjOLGb61SlmzKQrNmOYMb8tpDJj+PZ9r82O5ywQCAQCgUAg8IFXa6Syf/OCFmoAAAAASUVORK5CYII="
-        placeholder_bytes = base64.b64decode(placeholder_base64)
-        return Response(
-            content=placeholder_bytes,
-            media_type="image/jpeg"
-        )
-
-@app.get("/api/vehicles/placeholder.svg")
-async def get_vehicle_placeholder():
-    """Retorna imagem placeholder para veículos sem foto - IMAGEM REAL DO UTILIZADOR"""
-    from fastapi.responses import Response
-    import base64
-    
-    # Imagem real do utilizador (placeholder.jpg convertida para base64)
-    placeholder_base64 = "iVBORw0KGgoAAAANSUhEUgAAAPAAAACgAgMAAABPtQn2AAAADFBMVEX////s7Oz29vbw8PCPhvoMAAACV0lEQVRo3u2Yv27bMBCHLRkaVMOjH0FA0aDo5N2P4MEnahBSPYJGj0L6DN49Fu7gqWMBoe+g3WPQvUsQRLFDxReYxxP/rPyWBPjpE0XyRPs8CQQCgUAgEAioxIdfff/UuKhf/oDk0V79D1e2lg98RNV27E9yWGRv7t51cMO98bA9StbTzoBAGG7YAsB96B2QND7y1lR2n3UHNJWBG4GG3GGnkNZ+ykgx6k5BixiV54BYL9mSkcsxGTga+41CKucpj693xsrC5H10q5OvwFM4vBTISe/GMIbYM7XpYUdgwKObzB9IKXjYKPOcfGTR8JXNs/WRhb3Mv5yJsVz6yMJHhsZHXvHnCE/tI5c+cu4jA/NxMU7Ln508K0p2LtCdjwwW1LT87/Bbq2C2Jo/t7fmfTtVus4KUG+3HjswyusSm8o53L02sepgxcjUDuKfWHTO93FxW5JTQJYkZKefxWxJR7uYtKyKtXKSXRMTklOeYkXItF7OlJl0tZdZJWd2qlbRqpcwxqxY6uRmeUHm1MVtnUlbLczqsjXL+Y1YmpNyBGJY5T1U3T/EvIe+uF4iI2Kk5ZoS8gE2Cj3gDZrScXeYjeVDlMgPJD1JO8IK/ios78EDKERTWMsLLS8woeXm9oB2TC0WelcYjrycKn43nXE1UjLeqZeRLC3840/d9RxVJzjUZE+T9Ps9DJlLdl8CI6TrTIYuP/U/uK/eGvjFmNEwzEWPGdrE104LUY83kisnasZ6OybjOLGb61SlmzKQrNmOYMb8tpDJj+PZ9r82O5ywQCAQCgUAg8IFXa6Syf/OCFmoAAAAASUVORK5CYII="
-    
-    # Decodificar base64 para bytes
-    placeholder_bytes = base64.b64decode(placeholder_base64)
-    
-    return Response(
-        content=placeholder_bytes,
-        media_type="image/jpeg",
-        headers={
-            "Cache-Control": "public, max-age=86400"
-        }
-    )
+        for name, data in rows:
+            if data:
+                hashes[name] = hashlib.sha256(bytes(data)).hexdigest()
+    return hashes
 
-@app.get("/api/vehicles/{vehicle_name}/photo/metadata")
-async def get_vehicle_photo_metadata(vehicle_name: str, request: Request):
-    """Retorna metadata da foto de um veículo (URL original, etc)"""
-    require_auth(request)
-    try:
-        vehicle_key = vehicle_name.lower().strip()
-        
+def _save_vehicle_image_results(photos: List[tuple], sources: List[tuple]):
+    """
+    photos: (vehicle_name, data, content_type, url) a gravar em vehicle_photos
+    sources: (vehicle_name, url, etag, last_modified, sha256) de todos os veículos verificados
+    """
+    _ensure_vehicle_photo_sources_table()
+    checked_at = datetime.now(timezone.utc).isoformat()
+    for i in range(0, max(len(photos), len(sources)), VEHICLE_IMAGE_WRITE_BATCH):
         with _db_lock:
             con = _db_connect()
             try:
-                # Try vehicle_photos first (has photo_url)
-                if con.__class__.__module__ == 'psycopg2.extensions':
-                    # PostgreSQL
-                    with con.cursor() as cur:
+                for name, data, content_type, url in photos[i:i + VEHICLE_IMAGE_WRITE_BATCH]:
+                    con.execute(
+                        """
+                        INSERT INTO vehicle_photos (vehicle_name, photo_data, content_type, photo_url)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(vehicle_name) DO UPDATE SET photo_data=excluded.photo_data,
+                            content_type=excluded.content_type, photo_url=excluded.photo_url
+                        """,
+                        (name, data, content_type, url)
+                    )
+                for name, url, etag, last_modified, content_hash in sources[i:i + VEHICLE_IMAGE_WRITE_BATCH]:
+                    con.execute(
+                        """
+                        INSERT INTO vehicle_photo_sources (vehicle_name, photo_url, etag, last_modified, content_hash, checked_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(vehicle_name) DO UPDATE SET photo_url=excluded.photo_url, etag=excluded.etag,
+                            last_modified=excluded.last_modified, content_hash=excluded.content_hash,
+                            checked_at=excluded.checked_at
+                        """,
+                        (name, url, etag, last_modified, content_hash, checked_at)
+                    )
+                con.commit()
+            finally:
+                con.close()
+
+async def _download_vehicle_images_job(job: "background_jobs.Job", refresh: bool = False) -> Dict[str, Any]:
+    """
+    Fotos em falta do VEHICLES + revalidação das que o pipeline já gravou
+    refresh: descarrega também as fotos antigas sem validadores e compara pelo sha256
+    """
+    from carjet_direct import VEHICLES
+    import httpx
+
+    skipped = 0
+    errors = []
+
+    # PRIMEIRO: URLs do histórico de scraping; SEGUNDO: mapeamento manual
+    photo_urls_from_scraping = await asyncio.to_thread(_car_images_photo_urls, VEHICLES)
+    print(f"[PHOTOS] Encontradas {len(photo_urls_from_scraping)} fotos no histórico de scraping", file=sys.stderr, flush=True)
+    image_keys, photo_keys, sources = await _run_db(_vehicle_image_state)
+
+    # Plano: URL -> veículos que dependem dele; hash conhecido da foto guardada de cada veículo
+    wanted: Dict[str, List[str]] = {}
+    known_hash: Dict[str, Optional[str]] = {}
+    conditional: Dict[str, set] = {}  # URL -> validadores dos veículos (condicional só se todos iguais)
+    legacy = []
+    for vehicle_key in VEHICLES.keys():
+        if vehicle_key in image_keys:
+            skipped += 1  # servido de vehicle_images; uma cópia em vehicle_photos nunca seria usada
+            continue
+        image_url = photo_urls_from_scraping.get(vehicle_key) or vehicle_photo_fetch.CARJET_IMAGE_URLS.get(vehicle_key)
+        source = sources.get(vehicle_key)
+        if vehicle_key in photo_keys:
+            if source is None and not refresh:
+                skipped += 1  # foto antiga (upload/outro script): não mexer sem refresh
+                continue
+            if not image_url:
+                skipped += 1
+                continue
+            if source is None:
+                legacy.append(vehicle_key)
+                conditional.setdefault(image_url, set()).add(None)
+            elif source["url"] == image_url and (source["etag"] or source["last_modified"]):
+                conditional.setdefault(image_url, set()).add((source["etag"], source["last_modified"]))
+            else:
+                conditional.setdefault(image_url, set()).add(None)
+            known_hash[vehicle_key] = source["hash"] if source else None
+        elif not image_url:
+            errors.append(f"{vehicle_key}: No photo URL found")
+            continue
+        else:
+            conditional.setdefault(image_url, set()).add(None)
+        wanted.setdefault(image_url, []).append(vehicle_key)
+
+    if legacy:
+        known_hash.update(await _run_db(_stored_vehicle_photo_hashes, legacy))
+
+    urls = {
+        url: next(iter(validators)) if len(validators) == 1 else None
+        for url, validators in conditional.items()
+    }
+    job.progress(0, len(urls), f"{len(urls)} fotos a verificar ({skipped} sem pedido)")
+
+    throughput = vehicle_photo_fetch.Throughput(VEHICLE_IMAGE_CONCURRENCY)
+
+    def on_result(fetch):
+        if fetch.status == vehicle_photo_fetch.ERROR:
+            print(f"[PHOTOS] ❌ {fetch.url[:80]}: {fetch.error}", file=sys.stderr, flush=True)
+        job.progress(advance=1, message=f"{throughput.downloaded} descarregadas, {throughput.not_modified} sem alterações")
+
+    limits = httpx.Limits(max_connections=VEHICLE_IMAGE_CONCURRENCY, max_keepalive_connections=VEHICLE_IMAGE_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=30.0, limits=limits, follow_redirects=True) as client:
+        fetches = await vehicle_photo_fetch.fetch_all(client, urls, VEHICLE_IMAGE_CONCURRENCY, on_result, throughput)
+
+    downloaded = 0
+    unchanged = 0
+    photos, checked = [], []
+    for url, vehicle_keys in wanted.items():
+        fetch = fetches[url]
+        for vehicle_key in vehicle_keys:
+            if fetch.status == vehicle_photo_fetch.ERROR:
+                errors.append(f"{vehicle_key}: {fetch.error}")
+                continue
+            if fetch.status == vehicle_photo_fetch.NOT_MODIFIED:
+                content_hash = known_hash.get(vehicle_key)
+                unchanged += 1
+            else:
+                content_hash = fetch.sha256
+                if known_hash.get(vehicle_key) == content_hash:
+                    unchanged += 1
+                else:
+                    photos.append((vehicle_key, fetch.data, fetch.content_type, url))
+                    downloaded += 1
+            checked.append((vehicle_key, url, fetch.etag, fetch.last_modified, content_hash))
+
+    job.progress(message=f"A gravar {len(photos)} fotos...")
+    await _run_db(_save_vehicle_image_results, photos, checked)
+    if photos:
+        _vehicle_photos_changed()
+
+    report = throughput.report()
+    print(f"[PHOTOS] {downloaded} gravadas, {unchanged} sem alterações, {skipped} ignoradas, {len(errors)} erros - "
+          f"{report['requests']} pedidos em {report['elapsed_seconds']}s ({report['requests_per_second']}/s, "
+          f"{report['mb_per_second']} MB/s)", file=sys.stderr, flush=True)
+    return {
+        "ok": True,
+        "downloaded": downloaded,
+        "unchanged": unchanged,
+        "skipped": skipped,
+        "errors": errors[:10],
+        "errors_count": len(errors),
+        "throughput": report,
+    }
+
+@app.post("/api/vehicles/images/download")
+async def download_vehicle_images(request: Request):
+    """
+    Download automático de todas as imagens de veículos dos URLs do scraping
+    Job em background (?wait=1 espera e devolve o resultado, como antes);
+    ?refresh=1 revalida também as fotos antigas (pelo sha256 do conteúdo)
+    """
+    # Não requer autenticação para funcionar em iframes
+    refresh = str(request.query_params.get("refresh", "")).strip().lower() in ("1", "true", "yes", "on")
+
+    async def run(job):
+        return await _download_vehicle_images_job(job, refresh)
+
+    return await _submit_job(request, "vehicle_images_download", run, params={"refresh": refresh},
+                             group="vehicle_photos")
+
+# --- Fotos de veículos: índice nome→foto + bytes quentes em memória ---
+# /api/vehicles/{name}/photo é pedido por cada <img> das tabelas de preços e dos emails.
+# O índice (só chaves e tamanhos, sem blobs) resolve o nome pelas mesmas regras das
+# queries de antes (exata em vehicle_images, exata em vehicle_photos, variação do modelo
+# base) sem ir à BD; os bytes ficam num LRU limitado em MB e o sha256 do conteúdo é o
+# ETag forte (If-None-Match -> 304 sem BD). As escritas de fotos chamam
+# _vehicle_photos_changed() (NOTIFY para os outros workers); escritas de fora da app
+# (scripts) apanham-se no recarregar do índice a cada VEHICLE_PHOTO_INDEX_TTL.
+VEHICLE_PHOTO_CACHE_MB = float(os.getenv("VEHICLE_PHOTO_CACHE_MB", "64") or 64)
+VEHICLE_PHOTO_INDEX_TTL = float(os.getenv("VEHICLE_PHOTO_INDEX_TTL", "300") or 300)
+VEHICLE_PHOTOS_CHANNEL = "vehicle_photos_changed"
+VEHICLE_PHOTO_MAX_RESOLVED = 20000  # nomes pedidos memorizados (endpoint público)
+_VEHICLE_MODEL_SUFFIXES = (' auto', ' automatic', ' hybrid', ' electric', ' diesel', ' 4x4', ', hybrid', ', electric', ', diesel', ', automatic')
+_VEHICLE_SW_MARKERS = ('sw', 'station wagon', 'estate')
+_VEHICLE_PHOTO_MISSING = object()
+_VEHICLE_PLACEHOLDER_IMAGE = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAPAAAACgAgMAAABPtQn2AAAADFBMVEX////s7Oz29vbw8PCPhvoMAAACV0lEQVRo3u2Yv27bMBCHLRkaVMOjH0FA0aDo5N2P4MEnahBSPYJGj0L6DN49Fu7gqWMBoe+g3WPQvUsQRLFDxReYxxP/rPyWBPjpE0XyRPs8CQQCgUAgEAioxIdfff/UuKhf/oDk0V79D1e2lg98RNV27E9yWGRv7t51cMO98bA9StbTzoBAGG7YAsB96B2QND7y1lR2n3UHNJWBG4GG3GGnkNZ+ykgx6k5BixiV54BYL9mSkcsxGTga+41CKucpj693xsrC5H10q5OvwFM4vBTISe/GMIbYM7XpYUdgwKObzB9IKXjYKPOcfGTR8JXNs/WRhb3Mv5yJsVz6yMJHhsZHXvHnCE/tI5c+cu4jA/NxMU7Ln508K0p2LtCdjwwW1LT87/Bbq2C2Jo/t7fmfTtVus4KUG+3HjswyusSm8o53L02sepgxcjUDuKfWHTO93FxW5JTQJYkZKefxWxJR7uYtKyKtXKSXRMTklOeYkXItF7OlJl0tZdZJWd2qlbRqpcwxqxY6uRmeUHm1MVtnUlbLczqsjXL+Y1YmpNyBGJY5T1U3T/EvIe+uF4iI2Kk5ZoS8gE2Cj3gDZrScXeYjeVDlMgPJD1JO8IK/ios78EDKERTWMsLLS8woeXm9oB2TC0WelcYjrycKn43nXE1UjLeqZeRLC3840/d9RxVJzjUZE+T9Ps9DJlLdl8CI6TrTIYuP/U/uK/eGvjFmNEwzEWPGdrE104LUY83kisnasZ6OybjOLGb61SlmzKQrNmOYMb8tpDJj+PZ9r82O5ywQCAQCgUAg8IFXa6Syf/OCFmoAAAAASUVORK5CYII=")
+
+class _VehiclePhotoCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.generation = 0  # sobe a cada invalidação; descarta leituras concorrentes antigas
+        self._lock = Lock()
+        self._loaded_at: Optional[float] = None
+        self._sizes: Dict[Tuple[str, str], int] = {}  # (tabela, chave) -> tamanho na BD
+        self._image_keys: List[str] = []  # vehicle_images ordenado, para as variações por prefixo
+        self._resolved: Dict[str, Any] = {}  # nome pedido -> (tabela, chave) | None
+        self._meta: Dict[Tuple[str, str], Tuple[int, str, str]] = {}  # ref -> (tamanho, etag, content_type)
+        self._bytes: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._bytes_total = 0
+        self.stats = {
+            "hits": 0, "meta_hits": 0, "negative_hits": 0, "misses": 0,
+            "not_modified": 0, "index_loads": 0, "evictions": 0, "invalidations": 0,
+        }
+
+    def fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < VEHICLE_PHOTO_INDEX_TTL
+
+    def load_index(self, image_rows, photo_rows, generation: int):
+        """(chave, tamanho) das duas tabelas; mantém bytes/ETags das fotos com o mesmo tamanho"""
+        sizes = {}
+        for table, rows in (("vehicle_photos", photo_rows), ("vehicle_images", image_rows)):
+            for key, size in rows:
+                if key is not None and size is not None:
+                    sizes[(table, key)] = int(size)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._sizes = sizes
+            self._image_keys = sorted(key for table, key in sizes if table == "vehicle_images")
+            self._resolved.clear()
+            for ref in [ref for ref, meta in self._meta.items() if sizes.get(ref) != meta[0]]:
+                del self._meta[ref]
+                self._drop_bytes(ref)
+            self._loaded_at = time.monotonic()
+            self.stats["index_loads"] += 1
+
+    def _resolve(self, name: str):
+        if ("vehicle_images", name) in self._sizes:
+            return ("vehicle_images", name)
+        if ("vehicle_photos", name) in self._sizes:
+            return ("vehicle_photos", name)
+        # Variações do mesmo modelo (ex: "citroen c1" de "citroen c1 auto");
+        # Station Wagon (SW) são modelos diferentes!
+        is_sw = ' sw' in name or 'station wagon' in name or 'estate' in name
+        base_model = name
+        for suffix in _VEHICLE_MODEL_SUFFIXES:
+            base_model = base_model.replace(suffix, '')
+        base_model = base_model.strip()
+        start = bisect.bisect_left(self._image_keys, base_model)
+        for key in self._image_keys[start:]:
+            if not key.startswith(base_model):
+                break
+            if any(marker in key for marker in _VEHICLE_SW_MARKERS) == is_sw:
+                return ("vehicle_images", key)
+        return None
+
+    def resolve(self, name: str):
+        with self._lock:
+            if name not in self._resolved:
+                if len(self._resolved) >= VEHICLE_PHOTO_MAX_RESOLVED:
+                    self._resolved.clear()
+                self._resolved[name] = self._resolve(name)
+            return self._resolved[name]
+
+    def peek(self, name: str):
+        """Sem BD: _VEHICLE_PHOTO_MISSING, (ref, etag, content_type, bytes|None) ou None (ir à BD)"""
+        if not self.fresh():
+            return None
+        ref = self.resolve(name)
+        with self._lock:
+            if ref is None:
+                self.stats["negative_hits"] += 1
+                return _VEHICLE_PHOTO_MISSING
+            meta = self._meta.get(ref)
+            if meta is None:
+                return None
+            data = self._bytes.get(ref)
+            if data is not None:
+                self._bytes.move_to_end(ref)
+            return ref, meta[1], meta[2], data
+
+    def store(self, ref, data: bytes, content_type: str, generation: int):
+        etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+        with self._lock:
+            if generation == self.generation:
+                self._meta[ref] = (len(data), etag, content_type)
+                self._drop_bytes(ref)
+                if len(data) <= self.max_bytes // 4:
+                    self._bytes[ref] = data
+                    self._bytes_total += len(data)
+                    while self._bytes_total > self.max_bytes:
+                        _, old = self._bytes.popitem(last=False)
+                        self._bytes_total -= len(old)
+                        self.stats["evictions"] += 1
+        return ref, etag, content_type, data
+
+    def _drop_bytes(self, ref):
+        old = self._bytes.pop(ref, None)
+        if old is not None:
+            self._bytes_total -= len(old)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self.stats["invalidations"] += 1
+            self._loaded_at = None
+            self._resolved.clear()
+            self._meta.clear()
+            self._bytes.clear()
+            self._bytes_total = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            served = self.stats["hits"] + self.stats["meta_hits"] + self.stats["negative_hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "indexed_photos": len(self._sizes),
+                "etags": len(self._meta),
+                "hot_photos": len(self._bytes),
+                "hot_bytes": self._bytes_total,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round((served - self.stats["misses"]) / served, 4) if served else 0.0,
+                "index_age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+            }
+
+_VEHICLE_PHOTOS = _VehiclePhotoCache(int(VEHICLE_PHOTO_CACHE_MB * 1024 * 1024))
+
+def _on_vehicle_photos_note(payload: str):
+    if payload != _WORKER_ID:
+        _VEHICLE_PHOTOS.invalidate()
+
+_PG_LISTEN_HANDLERS[VEHICLE_PHOTOS_CHANNEL] = _on_vehicle_photos_note
+
+def _vehicle_photos_changed():
+    """Chamar depois de gravar em vehicle_images/vehicle_photos (este worker + NOTIFY aos outros)"""
+    _VEHICLE_PHOTOS.invalidate()
+    if not (_USE_NEW_DB and USE_POSTGRES):
+        return
+    try:
+        with _db_lock:
+            conn = _db_connect()
+            try:
+                conn.execute("SELECT pg_notify(?, ?)", (VEHICLE_PHOTOS_CHANNEL, _WORKER_ID))
+                conn.commit()
+            finally:
+                conn.close()
+    except Exception as e:
+        logging.warning(f"[PHOTOS] notify: {e}")
+
+def _vehicle_photo_rows(con, sql: str, params: tuple = ()):
+    if con.__class__.__module__ == 'psycopg2.extensions':
+        # PostgreSQL - usar cursor
+        with con.cursor() as cur:
+            cur.execute(sql.replace('?', '%s'), params)
+            return cur.fetchall()
+    return con.execute(sql, params).fetchall()
+
+def _load_vehicle_photo(vehicle_key: str):
+    """Miss da cache: recarrega o índice se preciso e lê a foto; corre no executor da BD"""
+    generation = _VEHICLE_PHOTOS.generation
+    with _db_lock:
+        con = _db_connect()
+        try:
+            if not _VEHICLE_PHOTOS.fresh():
+                _VEHICLE_PHOTOS.load_index(
+                    _vehicle_photo_rows(con, "SELECT vehicle_key, length(image_data) FROM vehicle_images"),
+                    _vehicle_photo_rows(con, "SELECT vehicle_name, length(photo_data) FROM vehicle_photos"),
+                    generation,
+                )
+            ref = _VEHICLE_PHOTOS.resolve(vehicle_key)
+            if ref is None:
+                return _VEHICLE_PHOTO_MISSING
+            table, key = ref
+            if table == "vehicle_images":
+                rows = _vehicle_photo_rows(con, "SELECT image_data, content_type FROM vehicle_images WHERE vehicle_key = ?", (key,))
+            else:
+                rows = _vehicle_photo_rows(con, "SELECT photo_data, content_type FROM vehicle_photos WHERE vehicle_name = ?", (key,))
+        finally:
+            con.close()
+    if not rows or rows[0][0] is None:
+        return _VEHICLE_PHOTO_MISSING
+    # Convert memoryview to bytes (PostgreSQL compatibility)
+    return _VEHICLE_PHOTOS.store(ref, bytes(rows[0][0]), rows[0][1] or 'image/jpeg', generation)
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+@app.get("/api/vehicles/{vehicle_name}/photo")
+async def get_vehicle_photo(vehicle_name: str, request: Request, w: int = 0, fmt: str = Query("", alias="format")):
+    """Retorna a foto de um veículo específico (?w=&format= -> thumbnail/WebP/AVIF)"""
+    # Não requer autenticação para permitir que as tags <img> funcionem
+    try:
+        # Normalizar nome do veículo
+        vehicle_key = vehicle_name.lower().strip()
+        variant = _variant_params(w, fmt)
+        
+        entry = _VEHICLE_PHOTOS.peek(vehicle_key)
+        if entry is not None and entry is not _VEHICLE_PHOTO_MISSING:
+            _, etag, content_type, data = entry
+            if variant is not None:
+                width, requested = variant
+                negotiated = image_variants.negotiate(requested, request.headers.get("accept", ""), content_type, _IMG_AVIF)
+                etag = _variant_etag(etag.strip('"'), width, negotiated)
+            if data is None and not _etag_matches(request.headers.get("if-none-match"), etag):
+                entry = None  # só temos o ETag e o browser não tem esta versão
+        if entry is None:
+            _VEHICLE_PHOTOS.stats["misses"] += 1
+            entry = await _run_db(_load_vehicle_photo, vehicle_key)
+        elif entry is not _VEHICLE_PHOTO_MISSING:
+            _VEHICLE_PHOTOS.stats["hits" if entry[3] is not None else "meta_hits"] += 1
+        
+        if entry is not _VEHICLE_PHOTO_MISSING:
+            _, etag, content_type, image_data = entry
+            headers = {"Cache-Control": "public, max-age=86400", "ETag": etag}
+            if variant is not None:
+                # image_data só falta quando o If-None-Match já bate com o ETag da variante (304)
+                return await _serve_image_variant(request, image_data, etag.strip('"'), content_type, variant, headers)
+            if _etag_matches(request.headers.get("if-none-match"), etag):
+                _VEHICLE_PHOTOS.stats["not_modified"] += 1
+                return Response(status_code=304, headers=headers)
+            headers["Content-Disposition"] = f"inline; filename={vehicle_key}.jpg"
+            return Response(content=image_data, media_type=content_type, headers=headers)
+        else:
+            # Retornar imagem placeholder JPG - IMAGEM REAL (placeholder.jpg)
+            return Response(
+                content=_VEHICLE_PLACEHOLDER_IMAGE,
+                media_type="image/jpeg"
+            )
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        logging.error(f"❌ [PHOTO-ERROR] Vehicle: {vehicle_name}, Error: {str(e)}")
+        logging.error(f"❌ [PHOTO-ERROR] Traceback:\n{error_details}")
+        
+        # Retornar placeholder JPG em caso de erro - IMAGEM REAL (placeholder.jpg)
+        return Response(
+            content=_VEHICLE_PLACEHOLDER_IMAGE,
+            media_type="image/jpeg"
+        )
+
+@app.get("/api/vehicles/placeholder.svg")
+async def get_vehicle_placeholder():
+    """Retorna imagem placeholder para veículos sem foto - IMAGEM REAL DO UTILIZADOR"""
+    from fastapi.responses import Response
+    import base64
+    
+    # Imagem real do utilizador (placeholder.jpg convertida para base64)
+    placeholder_base64 = "iVBORw0KGgoAAAANSUhEUgAAAPAAAACgAgMAAABPtQn2AAAADFBMVEX////s7Oz29vbw8PCPhvoMAAACV0lEQVRo3u2Yv27bMBCHLRkaVMOjH0FA0aDo5N2P4MEnahBSPYJGj0L6DN49Fu7gqWMBoe+g3WPQvUsQRLFDxReYxxP/rPyWBPjpE0XyRPs8CQQCgUAgEAioxIdfff/UuKhf/oDk0V79D1e2lg98RNV27E9yWGRv7t51cMO98bA9StbTzoBAGG7YAsB96B2QND7y1lR2n3UHNJWBG4GG3GGnkNZ+ykgx6k5BixiV54BYL9mSkcsxGTga+41CKucpj693xsrC5H10q5OvwFM4vBTISe/GMIbYM7XpYUdgwKObzB9IKXjYKPOcfGTR8JXNs/WRhb3Mv5yJsVz6yMJHhsZHXvHnCE/tI5c+cu4jA/NxMU7Ln508K0p2LtCdjwwW1LT87/Bbq2C2Jo/t7fmfTtVus4KUG+3HjswyusSm8o53L02sepgxcjUDuKfWHTO93FxW5JTQJYkZKefxWxJR7uYtKyKtXKSXRMTklOeYkXItF7OlJl0tZdZJWd2qlbRqpcwxqxY6uRmeUHm1MVtnUlbLczqsjXL+Y1YmpNyBGJY5T1U3T/EvIe+uF4iI2Kk5ZoS8gE2Cj3gDZrScXeYjeVDlMgPJD1JO8IK/ios78EDKERTWMsLLS8woeXm9oB2TC0WelcYjrycKn43nXE1UjLeqZeRLC3840/d9RxVJzjUZE+T9Ps9DJlLdl8CI6TrTIYuP/U/uK/eGvjFmNEwzEWPGdrE104LUY83kisnasZ6OybjOLGb61SlmzKQrNmOYMb8tpDJj+PZ9r82O5ywQCAQCgUAg8IFXa6Syf/OCFmoAAAAASUVORK5CYII="
+    
+    # Decodificar base64 para bytes
+    placeholder_bytes = base64.b64decode(placeholder_base64)
+    
+    return Response(
+        content=placeholder_bytes,
+        media_type="image/jpeg",
+        headers={
+            "Cache-Control": "public, max-age=86400"
+        }
+    )
+
+@app.get("/api/vehicles/{vehicle_name}/photo/metadata")
+async def get_vehicle_photo_metadata(vehicle_name: str, request: Request):
+    """Retorna metadata da foto de um veículo (URL original, etc)"""
+    require_auth(request)
+    try:
+        vehicle_key = vehicle_name.lower().strip()
+        
+        with _db_lock:
+            con = _db_connect()
+            try:
+                # Try vehicle_photos first (has photo_url)
+                if con.__class__.__module__ == 'psycopg2.extensions':
+                    # PostgreSQL
+                    with con.cursor() as cur:
                         cur.execute(
                             "SELECT photo_url, uploaded_at, content_type FROM vehicle_photos WHERE vehicle_name = %s",
                             (vehicle_key,)
@@ -20951,6 +22433,7 @@ async def download_vehicle_photo_from_url(vehicle_name: str, request: Request):
                 finally:
                     con.close()
             
+            _vehicle_photos_changed()
             return _no_store_json({
                 "ok": True,
                 "message": f"Foto baixada e salva para {vehicle_name}",
@@ -20991,6 +22474,7 @@ async def upload_vehicle_photo(vehicle_name: str, request: Request, file: Upload
             finally:
                 con.close()
         
+        _vehicle_photos_changed()
         return _no_store_json({
             "ok": True,
             "message": f"Foto enviada com sucesso para {vehicle_name}",
@@ -21111,6 +22595,7 @@ async def import_config(request: Request):
                     con.commit()
                 finally:
                     con.close()
+            invalidate_vehicle_classifier()
         
         # 2. Importar imagens
         if "images" in body:
@@ -21143,6 +22628,7 @@ async def import_config(request: Request):
                 finally:
                     con.close()
         
+        _vehicle_photos_changed()
         return _no_store_json({
             "ok": True,
             "message": "Configuração importada com sucesso",
@@ -21185,6 +22671,7 @@ async def upload_damage_report_template(request: Request, file: UploadFile = Fil
                 """, (filename, contents, file.content_type, request.session.get('username', 'unknown')))
                 
                 conn.commit()
+                _damage_pdf_template_changed()
                 
                 return {"ok": True, "message": "Template uploaded successfully", "filename": filename}
             finally:
@@ -21193,832 +22680,240 @@ async def upload_damage_report_template(request: Request, file: UploadFile = Fil
         logging.error(f"Error uploading template: {e}")
         return {"ok": False, "error": str(e)}
 
+# --- Extração dos Rental Agreements ---
+# As coordenadas do mapeador ficam compiladas em memória (ra_extractor.ExtractionPlan)
+# até mudarem: a gravação de coordenadas e o upload de template chamam
+# _ra_coordinates_changed() (NOTIFY para os outros workers); escritas de fora da app
+# apanham-se ao fim de RA_PLAN_TTL. A convenção das coordenadas resolvida no primeiro
+# RA fica no plan. Vários RAs de uma vez (extract-from-ra/batch) vão para um pool de
+# processos.
+RA_PLAN_TTL = float(os.getenv("RA_PLAN_TTL", "600") or 600)
+RA_EXTRACT_WORKERS = max(1, int(os.getenv("RA_EXTRACT_WORKERS", "2") or 2))
+RA_EXTRACT_MAX_FILES = 50  # por pedido batch
+RA_COORDINATES_CHANNEL = "ra_coordinates_changed"
+_RA_PLAN = None  # (plan, time.monotonic() do carregamento)
+_RA_PLAN_LOCK = threading.Lock()
+_RA_POOL = None
+_RA_STATS = {"extracted": 0, "batch_extracted": 0, "mapped": 0, "pattern_based": 0, "errors": 0,
+             "plan_loads": 0, "extract_seconds": 0.0}
+
+def _load_ra_coordinates() -> list:
+    with _db_lock:
+        conn = _db_connect()
+        try:
+            if conn.__class__.__module__ == 'psycopg2.extensions':
+                with conn.cursor() as cur:
+                    cur.execute("SELECT field_id, x, y, width, height, page FROM rental_agreement_coordinates ORDER BY field_id")
+                    rows = cur.fetchall()
+            else:
+                rows = conn.execute("SELECT field_id, x, y, width, height, page FROM rental_agreement_coordinates ORDER BY field_id").fetchall()
+        finally:
+            conn.close()
+    return [tuple(r) for r in rows]
+
+def _ra_plan():
+    """Plan das coordenadas atuais (recarrega após invalidação ou TTL; corre fora do event loop)"""
+    global _RA_PLAN
+    with _RA_PLAN_LOCK:
+        cached = _RA_PLAN
+        if cached is not None and time.monotonic() - cached[1] < RA_PLAN_TTL:
+            return cached[0]
+        coordinates = _load_ra_coordinates()
+        if cached is not None and cached[0].key == ra_extractor.plan_key(coordinates):
+            plan = cached[0]
+        else:
+            plan = ra_extractor.ExtractionPlan(coordinates)
+            _RA_STATS["plan_loads"] += 1
+            if not coordinates:
+                logging.info("⚠️  Nenhuma coordenada de RA mapeada (👉 /rental-agreement-mapper): extração por padrões")
+        _RA_PLAN = (plan, time.monotonic())
+        return plan
+
+def _on_ra_coordinates_note(payload: str):
+    global _RA_PLAN
+    if payload != _WORKER_ID:
+        _RA_PLAN = None
+
+_PG_LISTEN_HANDLERS[RA_COORDINATES_CHANNEL] = _on_ra_coordinates_note
+
+def _ra_coordinates_changed():
+    """Chamar depois de gravar rental_agreement_coordinates/templates (este worker + NOTIFY aos outros)"""
+    global _RA_PLAN
+    _RA_PLAN = None
+    if not (_USE_NEW_DB and USE_POSTGRES):
+        return
+    try:
+        with _db_lock:
+            conn = _db_connect()
+            try:
+                conn.execute("SELECT pg_notify(?, ?)", (RA_COORDINATES_CHANNEL, _WORKER_ID))
+                conn.commit()
+            finally:
+                conn.close()
+    except Exception as e:
+        logging.warning(f"[RA] notify: {e}")
+
+def _get_ra_pool():
+    global _RA_POOL
+    if _RA_POOL is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _RA_POOL = ProcessPoolExecutor(max_workers=RA_EXTRACT_WORKERS, mp_context=_process_pool_context())
+    return _RA_POOL
+
+def _shutdown_ra_pool():
+    global _RA_POOL
+    pool, _RA_POOL = _RA_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+atexit.register(_shutdown_ra_pool)
+
+def _count_ra_results(results: List[Dict[str, Any]], seconds: float):
+    for result in results:
+        if not result.get("ok"):
+            _RA_STATS["errors"] += 1
+        elif result["method"] == "mapped_coordinates":
+            _RA_STATS["mapped"] += 1
+        else:
+            _RA_STATS["pattern_based"] += 1
+    _RA_STATS["extract_seconds"] += seconds
+
+def _ra_extract_stats() -> Dict[str, Any]:
+    cached = _RA_PLAN
+    done = _RA_STATS["extracted"] + _RA_STATS["batch_extracted"]
+    return {
+        **_RA_STATS,
+        "extract_seconds": round(_RA_STATS["extract_seconds"], 3),
+        "avg_extract_ms": round(_RA_STATS["extract_seconds"] * 1000 / done, 1) if done else None,
+        "plan": cached[0].key[:8] if cached else None,
+        "fields": cached[0].field_count if cached else None,
+        "convention": cached[0].convention if cached else None,
+        "plan_age_seconds": round(time.monotonic() - cached[1], 1) if cached else None,
+        "workers": RA_EXTRACT_WORKERS,
+    }
+
+def _extract_ra(pdf_data: bytes) -> Dict[str, Any]:
+    started = time.perf_counter()
+    result = ra_extractor.extract(_ra_plan(), pdf_data)
+    _RA_STATS["extracted"] += 1
+    _count_ra_results([result], time.perf_counter() - started)
+    return result
+
+async def _extract_ras(pdfs: List[bytes]) -> List[Dict[str, Any]]:
+    """Vários RAs: divididos pelos processos do pool (mesmo formato que _extract_ra por RA)"""
+    if len(pdfs) < 2:
+        return [await asyncio.to_thread(_extract_ra, pdf) for pdf in pdfs]
+    plan = await asyncio.to_thread(_ra_plan)
+    chunk = -(-len(pdfs) // RA_EXTRACT_WORKERS)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(_get_ra_pool(), ra_extractor.extract_batch,
+                                 plan.key, plan.coordinates, plan.convention, pdfs[i:i + chunk])
+            for i in range(0, len(pdfs), chunk)
+        ))
+    except Exception as e:
+        # Pool partido (worker morto, etc.): recriar da próxima vez e extrair aqui
+        logging.error(f"[RA] batch pool failed: {type(e).__name__}: {e}")
+        _shutdown_ra_pool()
+        return [await asyncio.to_thread(_extract_ra, pdf) for pdf in pdfs]
+    if plan.convention is None:
+        plan.convention = next((p["convention"] for p in parts if p["convention"]), None)
+    results = [result for part in parts for result in part["results"]]
+    _RA_STATS["batch_extracted"] += len(results)
+    _count_ra_results(results, time.perf_counter() - started)
+    return results
+
 @app.post("/api/damage-reports/extract-from-ra")
 async def extract_from_rental_agreement(request: Request, file: UploadFile = File(...)):
     """Extrai campos do Rental Agreement PDF - Usa coordenadas mapeadas se disponíveis"""
     require_auth(request)
     
+    try:
+        contents = await file.read()
+        result = await asyncio.to_thread(_extract_ra, contents)
+        logging.info(f"✅ RA {file.filename}: {len(result['fields'])} campos ({result['method']})")
+        return result
+    
+    except Exception as e:
+        _RA_STATS["errors"] += 1
+        logging.error(f"Error extracting RA fields: {e}")
+        import traceback
+        return {"ok": False, "error": str(e), "traceback": traceback.format_exc()}
+
+@app.post("/api/damage-reports/extract-from-ra/batch")
+async def extract_from_rental_agreements_batch(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Extrai os campos de vários Rental Agreements de uma vez (pool de processos)
+    
+    Devolve um resultado por ficheiro, pela mesma ordem (como extract-from-ra).
+    """
+    require_auth(request)
+    
+    if len(files) > RA_EXTRACT_MAX_FILES:
+        return JSONResponse({
+            "ok": False,
+            "error": f"Too many files (max {RA_EXTRACT_MAX_FILES})"
+        }, status_code=400)
+    
+    try:
+        started = time.perf_counter()
+        pdfs = [await f.read() for f in files]
+        results = await _extract_ras(pdfs)
+        elapsed = time.perf_counter() - started
+        
+        logging.info(f"✅ Batch RA: {sum(1 for r in results if r.get('ok'))}/{len(files)} em {elapsed:.2f}s")
+        return JSONResponse({
+            "ok": True,
+            "results": [
+                {"filename": f.filename, **result}
+                for f, result in zip(files, results)
+            ],
+            "extracted": sum(1 for r in results if r.get("ok")),
+            "failed": sum(1 for r in results if not r.get("ok")),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "per_second": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+        })
+    
+    except Exception as e:
+        logging.error(f"❌ Error extracting RA fields (batch): {e}")
+        import traceback
+        logging.error(traceback.format_exc())
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+
+@app.post("/api/rental-agreements/debug-lines")
+async def debug_rental_agreement_lines(request: Request, file: UploadFile = File(...)):
+    """DEBUG: Extrai TODAS as linhas do PDF numeradas para mapear campos"""
+    require_auth(request)
+    
     try:
         import PyPDF2
-        import re
         from io import BytesIO
         
         contents = await file.read()
         pdf_file = BytesIO(contents)
+        reader = PyPDF2.PdfReader(pdf_file)
         
-        # MÉTODO 1: Tentar usar coordenadas mapeadas (se existirem)
-        # ✅ REATIVADO - Usar coordenadas configuradas manualmente como PRIORIDADE
-        fields_from_mapping = {}
-        coords_rows = []
+        # Extrair TODO o texto
+        full_text = ""
+        for page_num, page in enumerate(reader.pages, 1):
+            page_text = page.extract_text()
+            full_text += f"\n=== PÁGINA {page_num} ===\n{page_text}\n"
         
-        try:
-            import fitz  # PyMuPDF
-            
-            # Carregar coordenadas mapeadas do RA
-            print("\n" + "="*80)
-            print("🚨 EXTRAÇÃO POR COORDENADAS - INÍCIO")
-            print("="*80)
-            logging.info("📍 Procurando coordenadas mapeadas...")
-            with _db_lock:
-                conn = _db_connect()
-                is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
-                
-                if is_postgres:
-                    with conn.cursor() as cur:
-                        cur.execute("SELECT field_id, x, y, width, height, page FROM rental_agreement_coordinates")
-                        coords_rows = cur.fetchall()
-                else:
-                    cursor = conn.execute("SELECT field_id, x, y, width, height, page FROM rental_agreement_coordinates")
-                    coords_rows = cursor.fetchall()
-            
-            print(f"🔍 Coordenadas encontradas: {len(coords_rows)}")
-            
-            if coords_rows:  # ✅ ATIVADO
-                print(f"✅ USANDO {len(coords_rows)} COORDENADAS MAPEADAS!")
-                logging.info(f"📍 Found {len(coords_rows)} mapped RA coordinates, extracting...")
-                
-                # Abrir PDF com PyMuPDF
-                pdf_doc = fitz.open(stream=contents, filetype="pdf")
-                
-                logging.info(f"\n{'='*60}")
-                logging.info(f"🔍 DIAGNÓSTICO DE COORDENADAS")
-                logging.info(f"{'='*60}")
-                
-                for row in coords_rows:
-                    field_id, x, y, width, height, page = row[0], row[1], row[2], row[3], row[4], row[5]
-                    
-                    try:
-                        # Ajustar para índice 0-based
-                        page_num = int(page) - 1 if page else 0
-                        
-                        if page_num < len(pdf_doc):
-                            pdf_page = pdf_doc[page_num]
-                            
-                            print(f"\n📍 Campo: {field_id}")
-                            print(f"   Coords: x={x:.1f}, y={y:.1f}, w={width:.1f}, h={height:.1f}")
-                            
-                            # TESTAR 4 VARIAÇÕES COMUNS DE COORDENADAS
-                            page_height = pdf_page.rect.height
-                            
-                            methods = {
-                                "DIRETO": (x, y, x + width, y + height),
-                                "INVERTIDO_Y": (x, page_height - y - height, x + width, page_height - y),
-                                "ESCALA_2": (x/2, y/2, (x + width)/2, (y + height)/2),
-                                "ESCALA_INV": (x/2, page_height - y/2 - height/2, (x + width)/2, page_height - y/2),
-                            }
-                            
-                            best_text = ""
-                            best_method = "DIRETO"
-                            
-                            # ✅ PRIORIDADE: Testar DIRETO primeiro
-                            for method_name, coords in methods.items():
-                                rect_test = fitz.Rect(*coords)
-                                text_test = pdf_page.get_text("text", clip=rect_test).strip()
-                                text_clean = ' '.join(text_test.split()) if text_test else ""
-                                
-                                if text_clean:
-                                    print(f"   {method_name}: '{text_clean[:40]}'")
-                                
-                                # Se DIRETO tiver texto, usar! Só tentar outros se DIRETO estiver vazio
-                                if method_name == "DIRETO" and text_clean:
-                                    best_text = text_clean
-                                    best_method = "DIRETO"
-                                    break  # ✅ USAR DIRETO E PARAR
-                                
-                                # Se DIRETO está vazio, testar outros métodos
-                                if not best_text and text_clean:
-                                    # Validação básica: se campo é location, deve ter letras
-                                    if 'Location' in field_id or 'location' in field_id:
-                                        if any(c.isalpha() for c in text_clean) and not any(char in text_clean for char in ['J5V', 'H4H', '08 -']):
-                                            best_text = text_clean
-                                            best_method = method_name
-                                    else:
-                                        best_text = text_clean
-                                        best_method = method_name
-                            
-                            text_extracted = best_text
-                            print(f"   ✅ Escolhido: {best_method} → '{text_extracted}'")
-                            logging.info(f"📍 {field_id}: '{text_extracted}' ({best_method})")
-                            
-                            # Se não extraiu texto, tentar OCR
-                            if not text_extracted:
-                                try:
-                                    import pytesseract
-                                    from PIL import Image
-                                    import io
-                                    
-                                    # Renderizar área como imagem
-                                    rect_ocr = fitz.Rect(x, y, x + width, y + height)
-                                    zoom = 2  # Aumentar resolução para OCR
-                                    mat = fitz.Matrix(zoom, zoom)
-                                    pix = pdf_page.get_pixmap(matrix=mat, clip=rect_ocr)
-                                    
-                                    # Converter para PIL Image
-                                    img_data = pix.tobytes("png")
-                                    img = Image.open(io.BytesIO(img_data))
-                                    
-                                    # Aplicar OCR
-                                    text_extracted = pytesseract.image_to_string(img, lang='por+eng', config='--psm 6').strip()
-                                    
-                                    if text_extracted:
-                                        logging.info(f"   🔍 OCR extraiu {field_id}: {text_extracted[:50]}")
-                                except Exception as ocr_error:
-                                    logging.debug(f"   ⚠️  OCR falhou para {field_id}: {ocr_error}")
-                            
-                            if text_extracted:
-                                fields_from_mapping[field_id] = text_extracted
-                                logging.info(f"   ✅ {field_id}: {text_extracted[:50]}")
-                    except Exception as e:
-                        logging.warning(f"   ⚠️  Error extracting {field_id}: {e}")
-                        continue
-                
-                pdf_doc.close()
-                
-                # Se extraiu campos usando coordenadas, processar e retornar
-                if fields_from_mapping:
-                    logging.info(f"✅ Extraídos {len(fields_from_mapping)} campos usando coordenadas mapeadas")
-                    logging.info(f"   Campos: {list(fields_from_mapping.keys())}")
-                    
-                    # Combinar campos para Damage Report
-                    if fields_from_mapping.get('postalCode') or fields_from_mapping.get('city'):
-                        postal_code_city = ' / '.join(filter(None, [
-                            fields_from_mapping.get('postalCode'),
-                            fields_from_mapping.get('city')
-                        ]))
-                        if postal_code_city:
-                            fields_from_mapping['postalCodeCity'] = postal_code_city
-                    
-                    if fields_from_mapping.get('vehicleBrand') or fields_from_mapping.get('vehicleModel'):
-                        brand_model = ' / '.join(filter(None, [
-                            fields_from_mapping.get('vehicleBrand'),
-                            fields_from_mapping.get('vehicleModel')
-                        ]))
-                        if brand_model:
-                            fields_from_mapping['vehicleBrandModel'] = brand_model
-                    
-                    # IMPORTANTE: Também verificar campo combinado já mapeado
-                    if fields_from_mapping.get('postalCodeCity') and not fields_from_mapping.get('postalCode'):
-                        # Se mapeou o campo combinado, dividir
-                        pcc = fields_from_mapping.get('postalCodeCity', '')
-                        if ' / ' in pcc:
-                            parts = pcc.split(' / ', 1)
-                            fields_from_mapping['postalCode'] = parts[0].strip()
-                            fields_from_mapping['city'] = parts[1].strip()
-                    
-                    if fields_from_mapping.get('vehicleBrandModel') and not fields_from_mapping.get('vehicleBrand'):
-                        # Se mapeou o campo combinado, dividir
-                        vbm = fields_from_mapping.get('vehicleBrandModel', '')
-                        if ' / ' in vbm:
-                            parts = vbm.split(' / ', 1)
-                            fields_from_mapping['vehicleBrand'] = parts[0].strip()
-                            fields_from_mapping['vehicleModel'] = parts[1].strip()
-                    
-                    # Calcular país automaticamente baseado no código postal
-                    postal_code = fields_from_mapping.get('postalCode') or (fields_from_mapping.get('postalCodeCity', '').split(' / ')[0] if ' / ' in fields_from_mapping.get('postalCodeCity', '') else None)
-                    
-                    if postal_code and not fields_from_mapping.get('country'):
-                        # Detectar país pelo código postal
-                        country_detected = None
-                        
-                        # Portugal: 1000-001, 4000-123
-                        if re.match(r'^\d{4}-\d{3}$', postal_code):
-                            if postal_code[0] in '123456789':
-                                country_detected = 'PORTUGAL'
-                            else:
-                                country_detected = 'ESPANHA'
-                        # Espanha: 01234, 28001
-                        elif re.match(r'^0\d{4}$', postal_code):
-                            country_detected = 'ESPANHA'
-                        # Reino Unido: SW1A 1AA, W1A 0AX
-                        elif re.match(r'^[A-Z]{1,2}\d{1,2}[A-Z]?\s?\d[A-Z]{2}$', postal_code):
-                            country_detected = 'UNITED KINGDOM'
-                        # USA: 12345, 12345-6789
-                        elif re.match(r'^\d{5}(?:-\d{4})?$', postal_code):
-                            country_detected = 'USA'
-                        # França: 75001, 69000, 13000, 31000
-                        elif re.match(r'^\d{5}$', postal_code) and postal_code[0:2] in ['75', '69', '13', '31', '44', '33', '34', '35', '06', '76']:
-                            country_detected = 'FRANCE'
-                        # Alemanha: 10115, 80331
-                        elif re.match(r'^\d{5}$', postal_code) and postal_code[0:2] in ['10', '20', '30', '40', '50', '60', '70', '80', '90', '01', '02', '03', '04', '14', '15']:
-                            country_detected = 'GERMANY'
-                        # Itália: 00100, 20100
-                        elif re.match(r'^\d{5}$', postal_code) and postal_code[0:2] in ['00', '20', '10', '50', '40', '16', '70', '80', '90']:
-                            country_detected = 'ITALY'
-                        # Holanda: 1012 AB, 1012AB
-                        elif re.match(r'^\d{4}\s?[A-Z]{2}$', postal_code):
-                            country_detected = 'NETHERLANDS'
-                        # Bélgica: 1000, 2000
-                        elif re.match(r'^[1-9]\d{3}$', postal_code):
-                            country_detected = 'BELGIUM'
-                        # Suíça: 8001, 1200
-                        elif re.match(r'^\d{4}$', postal_code) and postal_code[0] in ['1', '2', '3', '4', '5', '6', '7', '8', '9']:
-                            country_detected = 'SWITZERLAND'
-                        # Canadá: K1A 0B1
-                        elif re.match(r'^[A-Z]\d[A-Z]\s?\d[A-Z]\d$', postal_code):
-                            country_detected = 'CANADA'
-                        
-                        if country_detected:
-                            fields_from_mapping['country'] = country_detected
-                            logging.info(f"   🌍 País detectado automaticamente: {country_detected} (de código postal: {postal_code})")
-                    
-                    # ✅ SEMPRE retornar se extraiu QUALQUER campo das coordenadas
-                    # NãO usar fallback de padrões se coordenadas estão configuradas
-                    print("\n" + "="*80)
-                    print(f"✅ EXTRAÇÃO CONCLUÍDA: {len(fields_from_mapping)} campos extraídos")
-                    print("="*80)
-                    for field_id, value in fields_from_mapping.items():
-                        print(f"   • {field_id}: {value[:50] if len(value) > 50 else value}")
-                    print("="*80)
-                    
-                    # MAPEAR CAMPOS DO RA PARA DAMAGE REPORT (nomes corretos)
-                    # O frontend espera estes nomes exatos de campos
-                    dr_fields = {}
-                    
-                    # Mapear cada campo extraído para o nome correto do DR
-                    field_mapping = {
-                        'contractNumber': 'contractNumber',      # Número do Contrato → DR Nº Contrato (= RA Number)
-                        'clientName': 'clientName',              # Nome do Cliente
-                        'clientEmail': 'clientEmail',            # Email do Cliente  
-                        'clientPhone': 'clientPhone',            # Telefone do Cliente
-                        'address': 'address',                    # Morada
-                        'city': 'city',                          # Cidade
-                        'postalCode': 'postalCode',              # Código Postal
-                        'postalCodeCity': 'postalCodeCity',      # Código Postal / Cidade (combinado)
-                        'country': 'country',                    # País
-                        'vehiclePlate': 'vehiclePlate',          # Matrícula
-                        'vehicleBrand': 'vehicleBrand',          # Marca
-                        'vehicleModel': 'vehicleModel',          # Modelo
-                        'vehicleBrandModel': 'vehicleBrandModel', # Marca / Modelo (combinado)
-                        'pickupDate': 'pickupDate',              # Data de Levantamento
-                        'pickupTime': 'pickupTime',              # Hora de Levantamento
-                        'pickupLocation': 'pickupLocation',      # Local de Levantamento
-                        'pickupFuel': 'pickupFuel',              # Combustível Levantamento
-                        'returnDate': 'returnDate',              # Data de Devolução
-                        'returnTime': 'returnTime',              # Hora de Devolução
-                        'returnLocation': 'returnLocation',      # Local de Devolução
-                        'returnFuel': 'returnFuel',              # Combustível Devolução
-                    }
-                    
-                    # Copiar campos mapeados
-                    for ra_field, dr_field in field_mapping.items():
-                        if ra_field in fields_from_mapping and fields_from_mapping[ra_field]:
-                            dr_fields[dr_field] = fields_from_mapping[ra_field]
-                            logging.info(f"   ✅ Mapeado: {ra_field} → {dr_field} = {fields_from_mapping[ra_field][:50]}")
-                    
-                    # Limpar matrícula: remover espaços entre números e letras
-                    # "3 0 - X Q - 9 7" → "30-XQ-97"
-                    if 'vehiclePlate' in dr_fields:
-                        plate = dr_fields['vehiclePlate']
-                        # Remover espaços mas manter hífens
-                        plate_clean = plate.replace(' ', '')
-                        dr_fields['vehiclePlate'] = plate_clean
-                        logging.info(f"   🚗 Matrícula limpa: '{plate}' → '{plate_clean}'")
-                    
-                    # Se tiver postalCodeCity combinado, dividir
-                    if 'postalCodeCity' in dr_fields and ' / ' in dr_fields['postalCodeCity']:
-                        parts = dr_fields['postalCodeCity'].split(' / ', 1)
-                        if not dr_fields.get('postalCode'):
-                            dr_fields['postalCode'] = parts[0].strip()
-                        if not dr_fields.get('city') and len(parts) > 1:
-                            dr_fields['city'] = parts[1].strip()
-                    
-                    # Se tiver vehicleBrandModel combinado, dividir
-                    if 'vehicleBrandModel' in dr_fields and ' / ' in dr_fields['vehicleBrandModel']:
-                        parts = dr_fields['vehicleBrandModel'].split(' / ', 1)
-                        if not dr_fields.get('vehicleBrand'):
-                            dr_fields['vehicleBrand'] = parts[0].strip()
-                        if not dr_fields.get('vehicleModel') and len(parts) > 1:
-                            dr_fields['vehicleModel'] = parts[1].strip()
-                    
-                    # ✅ COPIAR CONTRACT NUMBER PARA RA NUMBER (são o mesmo campo!)
-                    # Contract Number = Rental Agreement Number = ex: 06424-09
-                    if 'contractNumber' in dr_fields and dr_fields['contractNumber']:
-                        dr_fields['raNumber'] = dr_fields['contractNumber']
-                        logging.info(f"   ✅ RA Number = Contract Number: {dr_fields['raNumber']}")
-                    
-                    logging.info(f"✅ SUCESSO: {len(dr_fields)} campos mapeados para Damage Report")
-                    logging.info("   ⚡ Retornando campos prontos para inserir no DR")
-                    return {"ok": True, "fields": dr_fields, "method": "mapped_coordinates"}
+        # Dividir em linhas
+        lines = full_text.split('\n')
         
-            else:
-                # Não tinha coordenadas mapeadas
-                print("\n⚠️  NENHUMA COORDENADA MAPEADA ENCONTRADA!")
-                print("   👉 Acesse /rental-agreement-mapper para configurar\n")
-                logging.info("⚠️  Nenhuma coordenada mapeada encontrada no banco")
-                logging.info("   👉 Acesse /rental-agreement-mapper para configurar")
+        # Numerar linhas
+        numbered_lines = []
+        for i, line in enumerate(lines, 1):
+            numbered_lines.append({
+                "line_number": i,
+                "text": line.strip(),
+                "length": len(line.strip())
+            })
         
-        except Exception as e:
-            print("\n" + "="*80)
-            print(f"❌ ERRO NA EXTRAÇÃO POR COORDENADAS: {e}")
-            print("="*80)
-            logging.error(f"❌ Erro ao extrair usando coordenadas: {e}")
-            import traceback
-            logging.error(traceback.format_exc())
-            # Continuar para método fallback (padrões)
-        
-        # MÉTODO 2: Extração INTELIGENTE por PADRÕES (robusta para tamanhos variáveis)
-        print("\n" + "="*80)
-        print("⚠️  USANDO FALLBACK: EXTRAÇÃO POR PADRÕES")
-        print("="*80)
-        logging.info("📄 Using PATTERN-BASED intelligent extraction")
-        reader = PyPDF2.PdfReader(pdf_file)
-        
-        # Extrair todo o texto
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        
-        # Dividir em linhas para análise contextual
-        lines = text.split('\n')
-        
-        def clean_spaces(text):
-            """Remove espaços extras entre caracteres"""
-            # Remove espaços entre letras/números individuais
-            # Ex: "3 0 - X Q - 9 7" → "30-XQ-97"
-            cleaned = re.sub(r'(\w)\s+(?=\w)', r'\1', text)
-            # Remove espaços ao redor de hífens
-            cleaned = re.sub(r'\s*-\s*', '-', cleaned)
-            return cleaned
-        
-        def extract_country_code(text):
-            """Extrai código do país (ex: DE, PT, ES)"""
-            match = re.search(r'\b([A-Z]{2})\b', text)
-            return match.group(1) if match else text.strip()
-        
-        def split_postal_city(text):
-            """Divide código postal e cidade da mesma linha"""
-            # Padrões comuns: "8000-000 FARO", "12345 LISBOA", etc
-            match = re.match(r'([\d-]+)\s+(.+)', text)
-            if match:
-                return match.group(1).strip(), match.group(2).strip()
-            return text, ""
-        
-        def extract_email_phone(text):
-            """Extrai email e telefone da mesma linha"""
-            email = ""
-            phone = ""
-            
-            email_match = re.search(r'([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})', text, re.IGNORECASE)
-            if email_match:
-                email = email_match.group(1).lower()
-            
-            # Telefone: 9 dígitos
-            phone_match = re.search(r'(\d{9})', text)
-            if phone_match:
-                phone = phone_match.group(1)
-            
-            return email, phone
-        
-        def extract_brand_model(text):
-            """Extrai marca e modelo da mesma linha"""
-            # Ex: "PEUGEOT 308" ou "VOLKSWAGEN GOLF"
-            parts = text.split()
-            if len(parts) >= 2:
-                return parts[0], ' '.join(parts[1:])
-            return text, ""
-        
-        def clean_time(text):
-            """Limpa hora removendo números extras"""
-            # Ex: "12 : 009  8  4  1  3" → "12:00"
-            match = re.search(r'(\d{1,2})\s*:\s*(\d{2})', text)
-            if match:
-                return f"{match.group(1)}:{match.group(2)}"
-            return text.strip()
-        
-        def extract_time_location(text):
-            """Extrai hora e local da mesma linha (Linha 25)"""
-            # Ex: "12:00 AEROPORTO FARO"
-            match = re.match(r'([\d:]+)\s+(.+)', text)
-            if match:
-                time = clean_time(match.group(1))
-                location = match.group(2).strip()
-                return time, location
-            return "", text
-        
-        fields = {}
-        
-        # === 1. NÚMERO DO CONTRATO ===
-        # Padrão: XXXXX-VV (5 dígitos, hífen, versão de 2 dígitos)
-        # Exemplo: 00000-09, 12345-01, etc.
-        contract_match = re.search(r'\b(\d{5}-\d{2})\b', text)
-        if contract_match:
-            fields['contractNumber'] = contract_match.group(1)
-            logging.info(f"   📝 Contrato: {fields['contractNumber']}")
-        
-        # === 2. EMAIL ===
-        # Padrão universal de email
-        email_match = re.search(r'\b([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})\b', text, re.IGNORECASE)
-        if email_match:
-            fields['clientEmail'] = email_match.group(1).lower()
-            logging.info(f"   📧 Email: {fields['clientEmail']}")
-        
-        # === 3. TELEFONE ===
-        # Padrão: Com ou sem indicativo internacional
-        # Exemplos: +351 912345678, 912345678, +34 600123456
-        phone_patterns = [
-            r'\+(\d{1,4})\s*(\d{9})',  # Com indicativo: +351 912345678
-            r'(\d{9})\s+[A-Z0-9._%+-]+@',  # Antes do email
-            r'(?<!\d)(\d{9})(?!\d)',  # 9 dígitos isolados
-        ]
-        for i, pattern in enumerate(phone_patterns):
-            phone_match = re.search(pattern, text)
-            if phone_match:
-                if i == 0:  # Com indicativo
-                    country_code = phone_match.group(1)
-                    phone_number = phone_match.group(2)
-                    fields['clientPhone'] = f"+{country_code} {phone_number}"
-                    logging.info(f"   📞 Telefone: {fields['clientPhone']}")
-                    break
-                else:
-                    # Sem indicativo
-                    phone = phone_match.group(1)
-                    # Validar que não é NIF (geralmente começa com 1,2,3,5,6,8)
-                    if not (phone.startswith(('1', '2', '3', '5', '6', '8')) and len(phone) == 9):
-                        fields['clientPhone'] = phone
-                        logging.info(f"   📞 Telefone: {phone}")
-                        break
-        
-        # === 4. NOME DO CLIENTE ===
-        # Estratégia: linha APÓS o contrato e ANTES do país
-        # Geralmente é uma linha com APENAS LETRAS MAIÚSCULAS
-        if contract_match:
-            contract_pos = text.find(contract_match.group(1))
-            text_after_contract = text[contract_pos + len(contract_match.group(1)):]
-            
-            # Procurar primeira linha que seja APENAS letras maiúsculas e espaços (2-50 chars)
-            name_match = re.search(r'\n\s*([A-ZÁÉÍÓÚÂÊÔÃÕÇ\s]{3,50}?)\s*\n', text_after_contract)
-            if name_match:
-                name = name_match.group(1).strip()
-                # Validar que não tem números
-                if not re.search(r'\d', name) and len(name.split()) >= 2:
-                    fields['clientName'] = name
-                    logging.info(f"   👤 Nome: {name}")
-        
-        # === 5. PAÍS ===
-        # Código de 2 letras isolado (DE, PT, ES, FR, etc.)
-        # Lista expandida de códigos ISO 3166-1 alpha-2
-        country_match = re.search(r'\b([A-Z]{2})\b', text)
-        if country_match:
-            country_code = country_match.group(1)
-            # Validar que é código de país conhecido (ISO 3166-1 alpha-2)
-            known_countries = [
-                # Europa
-                'PT', 'ES', 'FR', 'DE', 'IT', 'UK', 'GB', 'NL', 'BE', 'CH', 'AT', 'IE', 'PL',
-                'SE', 'NO', 'DK', 'FI', 'GR', 'CZ', 'HU', 'RO', 'BG', 'SK', 'HR', 'SI', 'LT',
-                'LV', 'EE', 'LU', 'MT', 'CY', 'IS', 'LI', 'MC', 'AD', 'SM', 'VA',
-                # América
-                'US', 'CA', 'MX', 'BR', 'AR', 'CL', 'CO', 'PE', 'VE', 'EC', 'UY', 'PY', 'BO',
-                # Ásia
-                'CN', 'JP', 'IN', 'KR', 'TH', 'MY', 'SG', 'ID', 'PH', 'VN', 'TR', 'IL', 'AE',
-                'SA', 'QA', 'KW', 'BH', 'OM', 'JO', 'LB',
-                # Oceania
-                'AU', 'NZ',
-                # África
-                'ZA', 'EG', 'MA', 'TN', 'DZ', 'NG', 'KE', 'GH',
-            ]
-            if country_code in known_countries:
-                fields['country'] = country_code
-                logging.info(f"   🌍 País: {country_code}")
-        
-        # === 6. CÓDIGO POSTAL E CIDADE ===
-        # Detectar por padrões de código postal MUNDIAL
-        postal_patterns = [
-            # Portugal: 8000-000, 1000-001
-            (r'\b(\d{4}-\d{3})\b', 'PORTUGAL'),
-            # Espanha: 28001, 08001
-            (r'\b([0-5]\d{4})\b', 'SPAIN'),
-            # Reino Unido: SW1A 1AA, M1 1AE, B33 8TH
-            (r'\b([A-Z]{1,2}\d{1,2}[A-Z]?\s?\d[A-Z]{2})\b', 'UK'),
-            # Estados Unidos: 12345, 12345-6789
-            (r'\b(\d{5}(?:-\d{4})?)\b', 'USA'),
-            # França: 75001, 13008
-            (r'\b([0-9]{5})\b', 'FRANCE'),
-            # Alemanha: 10115, 80331
-            (r'\b([0-9]{5})\b', 'GERMANY'),
-            # Itália: 00100, 20100
-            (r'\b([0-9]{5})\b', 'ITALY'),
-            # Holanda: 1012 AB, 1012AB
-            (r'\b(\d{4}\s?[A-Z]{2})\b', 'NETHERLANDS'),
-            # Bélgica: 1000, 2000
-            (r'\b([1-9]\d{3})\b', 'BELGIUM'),
-            # Suíça: 8001, 1200
-            (r'\b([1-9]\d{3})\b', 'SWITZERLAND'),
-            # Canadá: K1A 0B1, H2X 1Y7
-            (r'\b([A-Z]\d[A-Z]\s?\d[A-Z]\d)\b', 'CANADA'),
-            # Irlanda: D02 AF30, A65 F4E2
-            (r'\b([A-Z]\d{2}\s?[A-Z0-9]{4})\b', 'IRELAND'),
-            # Polónia: 00-950, 31-002
-            (r'\b(\d{2}-\d{3})\b', 'POLAND'),
-            # Áustria: 1010, 5020
-            (r'\b([1-9]\d{3})\b', 'AUSTRIA'),
-            # Grécia: 104 32, 546 21
-            (r'\b(\d{3}\s?\d{2})\b', 'GREECE'),
-        ]
-        
-        for pattern, country_hint in postal_patterns:
-            postal_match = re.search(pattern, text)
-            if postal_match:
-                postal_code = postal_match.group(1)
-                fields['postalCode'] = postal_code
-                logging.info(f"   📮 Código Postal: {postal_code}")
-                
-                # Procurar cidade ANTES do código postal (mesma linha)
-                # MELHORADO: Procura texto em MAIÚSCULAS antes do código postal
-                # Evita pegar números (XXXXX) ou texto aleatório
-                city_pattern = r'([A-ZÁÉÍÓÚÂÊÔÃÕÇÖÄÜSS][A-ZÁÉÍÓÚÂÊÔÃÕÇÖÄÜß\s-]{2,40}?)\s+' + re.escape(postal_code)
-                city_match = re.search(city_pattern, text)
-                if city_match:
-                    city = city_match.group(1).strip()
-                    # Validar que não é só números ou X's
-                    if not re.match(r'^[X0-9\s/-]+$', city):
-                        fields['city'] = city
-                        logging.info(f"   🏙️  Cidade: {city}")
-                
-                # Se não encontrou país ainda, usar hint
-                if not fields.get('country'):
-                    fields['country'] = country_hint
-                break
-        
-        # === 7. MORADA ===
-        # Procurar por palavras-chave MULTI-IDIOMA
-        address_keywords = [
-            # Português
-            'RUA', 'AVENIDA', 'TRAVESSA', 'LARGO', 'PRAÇA', 'URBANIZAÇÃO', 'ESTRADA',
-            # Alemão
-            'STRAßE', 'STRASSE', 'WEG', 'PLATZ', 'ALLEE', 'GASSE',
-            # Espanhol
-            'CALLE', 'AVENIDA', 'PLAZA', 'CAMINO',
-            # Inglês
-            'STREET', 'AVENUE', 'ROAD', 'LANE', 'DRIVE', 'BOULEVARD',
-            # Francês
-            'RUE', 'AVENUE', 'BOULEVARD', 'PLACE', 'CHEMIN',
-            # Italiano
-            'VIA', 'VIALE', 'CORSO', 'PIAZZA', 'STRADA',
-        ]
-        for keyword in address_keywords:
-            address_match = re.search(rf'\b({keyword}[^\n]{{1,80}})', text, re.IGNORECASE)
-            if address_match:
-                addr = address_match.group(1).strip()
-                # Limitar tamanho e remover excesso
-                if len(addr) < 100:
-                    fields['address'] = addr
-                    logging.info(f"   🏠 Morada: {addr}")
-                    break
-        
-        # === 8. MATRÍCULA ===
-        # Padrão português: XX-XX-XX (com ou sem espaços)
-        plate_patterns = [
-            r'([A-Z]{1,2}\s*-\s*\d{2}\s*-\s*[A-Z]{2})',  # Com espaços
-            r'([0-9]{2}\s*-\s*[A-Z]{2}\s*-\s*[0-9]{2})',  # Novo formato
-        ]
-        for pattern in plate_patterns:
-            plate_match = re.search(pattern, text)
-            if plate_match:
-                plate = clean_spaces(plate_match.group(1))
-                fields['vehiclePlate'] = plate
-                logging.info(f"   🚗 Matrícula: {plate}")
-                break
-        
-        # === 9. MARCA E MODELO DO VEÍCULO ===
-        # Procurar marcas conhecidas seguidas de modelo
-        known_brands = ['PEUGEOT', 'RENAULT', 'CITROEN', 'VOLKSWAGEN', 'VW', 'FORD', 'OPEL',
-                       'SEAT', 'FIAT', 'TOYOTA', 'NISSAN', 'HYUNDAI', 'KIA', 'BMW', 'MERCEDES',
-                       'AUDI', 'SKODA', 'MAZDA', 'HONDA', 'SUZUKI', 'DACIA', 'VOLVO']
-        
-        for brand in known_brands:
-            brand_pattern = rf'\b({brand})\s+([A-Z0-9\s.]+?)(?=\s*\n|$)'
-            brand_match = re.search(brand_pattern, text)
-            if brand_match:
-                fields['vehicleBrand'] = brand_match.group(1)
-                fields['vehicleModel'] = brand_match.group(2).strip()
-                logging.info(f"   🏭 Marca: {fields['vehicleBrand']}")
-                logging.info(f"   🚙 Modelo: {fields['vehicleModel']}")
-                break
-        
-        # === 10. DATAS E HORAS POR CONTEXTO ===
-        # NOVA ABORDAGEM: Usar palavras-chave para encontrar datas e horas corretas
-        from datetime import datetime
-        current_year = datetime.now().year
-        
-        # Palavras-chave para identificar seções de Entrega (Pickup) e Recolha (Dropoff)
-        pickup_keywords = ['ENTREGA', 'PICKUP', 'LEVANTAMENTO', 'SALIDA', 'DEPARTURE', 'ABHOL']
-        dropoff_keywords = ['RECOLHA', 'DROPOFF', 'DEVOLUÇÃO', 'DEVOLUCION', 'RETURN', 'RÜCKGABE']
-        
-        # Procurar por contexto de ENTREGA/LEVANTAMENTO
-        pickup_context = None
-        for keyword in pickup_keywords:
-            match = re.search(rf'{keyword}', text, re.IGNORECASE)
-            if match:
-                pickup_context = match.start()
-                logging.info(f"   ✅ Contexto Levantamento encontrado: {keyword}")
-                break
-        
-        # Procurar por contexto de RECOLHA/DEVOLUÇÃO
-        dropoff_context = None
-        for keyword in dropoff_keywords:
-            match = re.search(rf'{keyword}', text, re.IGNORECASE)
-            if match:
-                dropoff_context = match.start()
-                logging.info(f"   ✅ Contexto Devolução encontrado: {keyword}")
-                break
-        
-        # Padrões de data
-        date_pattern = r'(\d{2}\s*[/-]\s*\d{2}\s*[/-]\s*\d{4})'
-        time_pattern = r'(\d{1,2}\s*:\s*\d{2})'
-        
-        # === LEVANTAMENTO (PICKUP) ===
-        if pickup_context is not None:
-            # Procurar data APÓS a palavra-chave de pickup (próximos 200 caracteres)
-            pickup_section = text[pickup_context:pickup_context + 300]
-            
-            # Data
-            date_match = re.search(date_pattern, pickup_section)
-            if date_match:
-                date_clean = re.sub(r'\s+', '', date_match.group(1)).replace('/', '-')
-                try:
-                    day, month, year = map(int, date_clean.split('-'))
-                    if current_year - 1 <= year <= current_year + 2:
-                        fields['pickupDate'] = date_clean
-                        logging.info(f"   📅 Data Levantamento: {date_clean}")
-                except:
-                    pass
-            
-            # Hora (logo após a data)
-            time_match = re.search(time_pattern, pickup_section)
-            if time_match:
-                fields['pickupTime'] = clean_time(time_match.group(1))
-                logging.info(f"   🕐 Hora Levantamento: {fields['pickupTime']}")
-            
-            # Local (MAIÚSCULAS próximo da palavra-chave, antes da data)
-            location_match = re.search(r'\b([A-ZÄÖÜ][A-ZÄÖÜÁÉÍÓÚÂÊÔÃÕÇ\s]{5,50}?)\s+\d{2}\s*[/-]', pickup_section)
-            if location_match:
-                location = location_match.group(1).strip()
-                words = location.split()
-                has_business_keyword = re.search(r'AEROPORTO|AIRPORT|FLUGHAFEN|AUTO|RENT|STATION|PRUDENTE|CAR|CARS|HIRE', location, re.IGNORECASE)
-                
-                # VALIDAÇÕES:
-                # 1. Rejeitar se parece código/data (ex: "DE 16", "PT 20")
-                is_code_like = bool(re.match(r'^[A-Z]{2}\s+\d+$', location))
-                # 2. Rejeitar se só tem sigla + número (menos de 6 chars)
-                is_too_short = len(location.replace(' ', '')) < 6
-                # 3. Rejeitar se for exatamente 2 palavras simples SEM palavra-chave
-                is_person_name = (len(words) == 2 and not has_business_keyword)
-                
-                if not (is_code_like or is_too_short or is_person_name):
-                    fields['pickupLocation'] = location
-                    logging.info(f"   📍 Local Levantamento: {location}")
-                else:
-                    reason = "código/sigla" if is_code_like else "muito curto" if is_too_short else "provável nome"
-                    logging.info(f"   ⚠️  Local rejeitado ({reason}): {location}")
-        
-        # === DEVOLUÇÃO (DROPOFF) ===
-        if dropoff_context is not None:
-            # Procurar data APÓS a palavra-chave de dropoff (próximos 200 caracteres)
-            dropoff_section = text[dropoff_context:dropoff_context + 300]
-            
-            # Data
-            date_match = re.search(date_pattern, dropoff_section)
-            if date_match:
-                date_clean = re.sub(r'\s+', '', date_match.group(1)).replace('/', '-')
-                try:
-                    day, month, year = map(int, date_clean.split('-'))
-                    if current_year - 1 <= year <= current_year + 2:
-                        fields['dropoffDate'] = date_clean
-                        logging.info(f"   📅 Data Devolução: {date_clean}")
-                except:
-                    pass
-            
-            # Hora (logo após a data)
-            time_match = re.search(time_pattern, dropoff_section)
-            if time_match:
-                fields['dropoffTime'] = clean_time(time_match.group(1))
-                logging.info(f"   🕐 Hora Devolução: {fields['dropoffTime']}")
-            
-            # Local (MAIÚSCULAS próximo da palavra-chave, antes da data)
-            location_match = re.search(r'\b([A-ZÄÖÜ][A-ZÄÖÜÁÉÍÓÚÂÊÔÃÕÇ\s]{5,50}?)\s+\d{2}\s*[/-]', dropoff_section)
-            if location_match:
-                location = location_match.group(1).strip()
-                words = location.split()
-                has_business_keyword = re.search(r'AEROPORTO|AIRPORT|FLUGHAFEN|AUTO|RENT|STATION|PRUDENTE|CAR|CARS|HIRE', location, re.IGNORECASE)
-                
-                # VALIDAÇÕES:
-                # 1. Rejeitar se parece código/data (ex: "DE 16", "PT 20")
-                is_code_like = bool(re.match(r'^[A-Z]{2}\s+\d+$', location))
-                # 2. Rejeitar se só tem sigla + número (menos de 6 chars)
-                is_too_short = len(location.replace(' ', '')) < 6
-                # 3. Rejeitar se for exatamente 2 palavras simples SEM palavra-chave
-                is_person_name = (len(words) == 2 and not has_business_keyword)
-                
-                if not (is_code_like or is_too_short or is_person_name):
-                    fields['dropoffLocation'] = location
-                    logging.info(f"   📍 Local Devolução: {location}")
-                else:
-                    reason = "código/sigla" if is_code_like else "muito curto" if is_too_short else "provável nome"
-                    logging.info(f"   ⚠️  Local rejeitado ({reason}): {location}")
-        
-        # === 12. FALLBACK PARA LOCAIS ===
-        # Se não foram encontrados locais por contexto, tentar método antigo
-        if not fields.get('pickupLocation') or not fields.get('dropoffLocation'):
-            locations_found = []
-            for i, line in enumerate(lines):
-                # Se linha tem data, a linha anterior pode ser local
-                if re.search(r'\d{2}\s*[/-]\s*\d{2}\s*[/-]\s*\d{4}', line):
-                    if i > 0:
-                        prev_line = lines[i-1].strip()
-                        # Remover horas do início
-                        prev_line = re.sub(r'^\d{1,2}\s*:\s*\d{2}\s*', '', prev_line)
-                        # Se é maiúsculas e tem tamanho razoável e não é nome de pessoa
-                        if prev_line.isupper() and 5 <= len(prev_line) <= 50:
-                            words = prev_line.split()
-                            has_business_keyword = re.search(r'AEROPORTO|AIRPORT|AUTO|RENT|STATION|PRUDENTE|CAR|CARS|HIRE', prev_line, re.IGNORECASE)
-                            
-                            # VALIDAÇÕES:
-                            is_code_like = bool(re.match(r'^[A-Z]{2}\s+\d+', prev_line))
-                            is_too_short = len(prev_line.replace(' ', '')) < 6
-                            is_person_name = (len(words) == 2 and not has_business_keyword)
-                            
-                            # ACEITA se NÃO for código, muito curto ou nome de pessoa
-                            if not (is_code_like or is_too_short or is_person_name):
-                                locations_found.append(prev_line)
-            
-            if len(locations_found) >= 2:
-                if not fields.get('pickupLocation'):
-                    fields['pickupLocation'] = locations_found[0]
-                    logging.info(f"   📍 Local Levantamento (fallback): {locations_found[0]}")
-                if not fields.get('dropoffLocation'):
-                    fields['dropoffLocation'] = locations_found[1]
-                    logging.info(f"   📍 Local Devolução (fallback): {locations_found[1]}")
-            elif len(locations_found) == 1:
-                # Mesmo local
-                if not fields.get('pickupLocation'):
-                    fields['pickupLocation'] = locations_found[0]
-                if not fields.get('dropoffLocation'):
-                    fields['dropoffLocation'] = locations_found[0]
-                logging.info(f"   📍 Local (ambos, fallback): {locations_found[0]}")
-        
-        # COMBINAR CAMPOS para Damage Report
-        # Código Postal / Cidade
-        if fields.get('postalCode') or fields.get('city'):
-            postal_code_city = ' / '.join(filter(None, [fields.get('postalCode'), fields.get('city')]))
-            if postal_code_city:
-                fields['postalCodeCity'] = postal_code_city
-        
-        # Marca / Modelo
-        if fields.get('vehicleBrand') or fields.get('vehicleModel'):
-            brand_model = ' / '.join(filter(None, [fields.get('vehicleBrand'), fields.get('vehicleModel')]))
-            if brand_model:
-                fields['vehicleBrandModel'] = brand_model
-        
-        # ✅ COPIAR CONTRACT NUMBER PARA RA NUMBER (são o mesmo campo!)
-        # Contract Number = Rental Agreement Number = ex: 06424-09
-        if 'contractNumber' in fields and fields['contractNumber']:
-            fields['raNumber'] = fields['contractNumber']
-            logging.info(f"   ✅ RA Number = Contract Number: {fields['raNumber']}")
-        
-        # Log para debug
-        logging.info(f"✅ === CAMPOS EXTRAÍDOS (PATTERN-BASED) ===")
-        for key, value in fields.items():
-            logging.info(f"   {key}: {value}")
-        
-        return {"ok": True, "fields": fields, "method": "pattern_based"}
-        
-    except Exception as e:
-        logging.error(f"Error extracting RA fields: {e}")
-        import traceback
-        return {"ok": False, "error": str(e), "traceback": traceback.format_exc()}
-
-@app.post("/api/rental-agreements/debug-lines")
-async def debug_rental_agreement_lines(request: Request, file: UploadFile = File(...)):
-    """DEBUG: Extrai TODAS as linhas do PDF numeradas para mapear campos"""
-    require_auth(request)
-    
-    try:
-        import PyPDF2
-        from io import BytesIO
-        
-        contents = await file.read()
-        pdf_file = BytesIO(contents)
-        reader = PyPDF2.PdfReader(pdf_file)
-        
-        # Extrair TODO o texto
-        full_text = ""
-        for page_num, page in enumerate(reader.pages, 1):
-            page_text = page.extract_text()
-            full_text += f"\n=== PÁGINA {page_num} ===\n{page_text}\n"
-        
-        # Dividir em linhas
-        lines = full_text.split('\n')
-        
-        # Numerar linhas
-        numbered_lines = []
-        for i, line in enumerate(lines, 1):
-            numbered_lines.append({
-                "line_number": i,
-                "text": line.strip(),
-                "length": len(line.strip())
-            })
-        
-        logging.info(f"📄 DEBUG: Extraídas {len(numbered_lines)} linhas do PDF")
+        logging.info(f"📄 DEBUG: Extraídas {len(numbered_lines)} linhas do PDF")
         
         return {
             "ok": True,
@@ -22923,18 +23818,13 @@ async def get_email_template_by_lang(request: Request, lang: str):
 @app.get("/api/damage-reports/{dr_number:path}/pdf")
 async def download_damage_report_pdf(request: Request, dr_number: str, preview: bool = False):
     """Download ou Preview do Damage Report em PDF - Usa template mapeado com coordenadas"""
-    logging.error(f"🔥🔥🔥 ENDPOINT HIT! DR='{dr_number}', preview={preview} - ANTES REQUIRE_AUTH")
     require_auth(request)
-    logging.error(f"🔥🔥🔥 DEPOIS REQUIRE_AUTH - Executando código...")
     
     try:
         from starlette.responses import Response
         import json
         
-        logging.error(f"📄 ==================== PDF GENERATION START ====================")
-        logging.error(f"📄 Generating PDF for DR: '{dr_number}'")
-        logging.error(f"📄 DR number length: {len(dr_number)}")
-        logging.error(f"📄 DR number bytes: {dr_number.encode('utf-8')}")
+        logging.debug(f"📄 Generating PDF for DR: '{dr_number}'")
         
         # Buscar dados da base de dados
         with _db_lock:
@@ -22945,9 +23835,6 @@ async def download_damage_report_pdf(request: Request, dr_number: str, preview:
                 if conn.__class__.__module__ == 'psycopg2.extensions':
                     is_postgres = True
                 
-                logging.info(f"DB Type: {'PostgreSQL' if is_postgres else 'SQLite'}")
-                logging.info(f"Searching for DR: '{dr_number}' (length: {len(dr_number)})")
-                
                 if is_postgres:
                     cursor = conn.cursor()
                     cursor.execute("SELECT * FROM damage_reports WHERE dr_number = %s AND (is_deleted = 0 OR is_deleted IS NULL)", (dr_number,))
@@ -22974,152 +23861,17 @@ async def download_damage_report_pdf(request: Request, dr_number: str, preview:
                     logging.error(f"Available DRs: {[r[0] for r in available]}")
                     raise HTTPException(status_code=404, detail="Damage Report not found")
                 
-                logging.error(f"✅ DR found in database!")
-                logging.error(f"✅ Row columns: {columns[:10]}...")  # Primeiras 10 colunas
                 report = dict(zip(columns, row))
-                logging.error(f"✅ Report dict created with {len(report)} fields")
             finally:
                 conn.close()
         
-        # Formatar datas para dd-mm-yyyy (remover hora se existir)
-        def format_date(date_str):
-            if not date_str:
-                return ''
-            try:
-                from datetime import datetime
-                # Se já é objeto datetime
-                if isinstance(date_str, datetime):
-                    return date_str.strftime('%d-%m-%Y')
-                # Se é string
-                date_str = str(date_str)
-                # Remove hora se existir (ex: "2025-11-06 00:00:00" → "2025-11-06")
-                # Ou "2025-11-06T00:00:00" → "2025-11-06"
-                date_only = date_str.split(' ')[0].split('T')[0]
-                # Converte de yyyy-mm-dd para dd-mm-yyyy
-                dt = datetime.strptime(date_only, '%Y-%m-%d')
-                return dt.strftime('%d-%m-%Y')
-            except:
-                return str(date_str)  # Retorna original se falhar
-        
-        # Mapear campos da BD para IDs do mapeador (camelCase)
-        report_data = {
-            'dr_number': report.get('dr_number', ''),
-            'ra_number': report.get('ra_number', ''),
-            'contractNumber': report.get('contract_number', ''),
-            'date': format_date(report.get('date', '')),
-            'created_at': format_date(report.get('created_at', '')),
-            'inspection_date': format_date(report.get('date', '')),
-            'clientName': report.get('client_name', ''),
-            'clientEmail': report.get('client_email', ''),
-            'clientPhone': report.get('client_phone', ''),
-            'address': report.get('client_address', ''),
-            'city': report.get('client_city', ''),
-            'postalCode': report.get('client_postal_code', ''),
-            'country': report.get('client_country', ''),
-            'customer_postal': ' / '.join(filter(None, [report.get('client_postal_code', ''), report.get('client_city', '')])),
-            'customer_city': report.get('client_city', ''),
-            'vehiclePlate': report.get('vehicle_plate', ''),
-            'vehicleBrand': report.get('vehicle_brand', ''),
-            'vehicleModel': report.get('vehicle_model', ''),
-            'vehicleBrandModel': ' / '.join(filter(None, [report.get('vehicle_brand', ''), report.get('vehicle_model', '')])),
-            'vehicleColor': report.get('vehicle_color', ''),
-            'vehicleKm': report.get('vehicle_km', ''),
-            'pickupDate': format_date(report.get('pickup_date', '')),
-            'pickup_date': format_date(report.get('pickup_date', '')),
-            'pickupTime': report.get('pickup_time', ''),
-            'pickupLocation': report.get('pickup_location', ''),
-            'returnDate': format_date(report.get('return_date', '')),
-            'return_date': format_date(report.get('return_date', '')),
-            'returnTime': report.get('return_time', ''),
-            'returnLocation': report.get('return_location', ''),
-            'fuel_level_pickup': report.get('fuel_pickup', ''),
-            'fuel_level_return': report.get('fuel_return', ''),
-            'total_repair_cost': report.get('total_amount', ''),
-            'totalRepairCost': report.get('total_amount', ''),
-            'total_amount': report.get('total_amount', ''),
-            'inspector_name': report.get('issued_by', ''),
-            'issued_by': report.get('issued_by', ''),
-            'inspection_date': format_date(report.get('date', '')),
-            'damage_diagram_data': report.get('damage_diagram_data', ''),
-            'damageDiagramData': report.get('damage_diagram_data', '')
-        }
-        
-        # ✅ EXTRAIR DESCRIÇÕES INDIVIDUAIS DOS DANOS (damage_1, damage_2, ...)
-        damages_json = report.get('damage_diagram_data', '')
-        if damages_json:
-            try:
-                damages = json.loads(damages_json)
-                for damage in damages:
-                    num = damage.get('number')
-                    desc = damage.get('description', '')
-                    if num:
-                        report_data[f'damage_{num}'] = desc
-                logging.info(f"✅ Extraídas {len(damages)} descrições de danos")
-            except:
-                logging.warning("⚠️ Erro ao parsear damage_diagram_data")
-        
-        # ✅ EXTRAIR FOTOS INDIVIDUAIS (damagePhoto1, damagePhoto2, ...)
-        images_json = report.get('damage_images', '')
-        if images_json:
-            try:
-                images = json.loads(images_json)
-                for idx, image in enumerate(images):
-                    photo_data = image.get('data', '')
-                    report_data[f'damagePhoto{idx + 1}'] = photo_data
-                    report_data[f'damage_photo_{idx + 1}'] = photo_data
-                logging.info(f"✅ Extraídas {len(images)} fotos")
-            except:
-                logging.warning("⚠️ Erro ao parsear damage_images")
-        
-        # ✅ EXTRAIR ITENS DE REPARAÇÃO (repair_line_1, repair_line_2, ...)
-        repair_json = report.get('repair_items', '')
-        total_calculated = 0.0
-        if repair_json:
-            try:
-                repair_items = json.loads(repair_json)
-                for idx, item in enumerate(repair_items):
-                    line_num = idx + 1
-                    report_data[f'repair_line_{line_num}'] = item.get('description', '')
-                    report_data[f'repair_line_{line_num}_qty'] = str(item.get('quantity', ''))
-                    hours_val = item.get('hours', '')
-                    report_data[f'repair_line_{line_num}_hours'] = '-' if hours_val == 0 or hours_val == '0' else str(hours_val)
-                    report_data[f'repair_line_{line_num}_price'] = str(item.get('price', ''))
-                    report_data[f'repair_line_{line_num}_subtotal'] = str(item.get('total', ''))
-                    # Somar ao total
-                    total_calculated += float(item.get('total', 0))
-                logging.info(f"✅ Extraídos {len(repair_items)} itens de reparação")
-                logging.info(f"💰 Total calculado: {total_calculated:.2f} €")
-            except:
-                logging.warning("⚠️ Erro ao parsear repair_items")
-        
-        # ✅ SOBRESCREVER total_repair_cost com valor CALCULADO (igual ao preview)
-        if total_calculated > 0:
-            report_data['total_repair_cost'] = f"{total_calculated:.2f}"
-            report_data['totalRepairCost'] = f"{total_calculated:.2f}"
-            report_data['total_amount'] = f"{total_calculated:.2f}"
-            logging.info(f"✅ Total repair cost SOBRESCRITO: {total_calculated:.2f} €")
-        
-        # ✅ ADICIONAR CROQUI COM PINS
-        vehicle_diagram_blob = report.get('vehicle_damage_image')
-        if vehicle_diagram_blob:
-            import base64
-            try:
-                diagram_base64 = base64.b64encode(vehicle_diagram_blob).decode('utf-8')
-                report_data['vehicle_diagram'] = f'data:image/png;base64,{diagram_base64}'
-                logging.info("✅ Croqui com pins adicionado")
-            except:
-                logging.warning("⚠️ Erro ao converter vehicle_damage_image")
+        report_data = _damage_report_pdf_data(report)
         
-        # Usar função de overlay para preencher template
-        logging.error(f"🔧 Calling _fill_template_pdf_with_data...")
-        logging.error(f"🔧 Report data keys: {list(report_data.keys())[:15]}...")
+        # Usar função de overlay para preencher template (fora do event loop)
+        pdf_data = await asyncio.to_thread(_fill_template_pdf_with_data, report_data)
         
-        pdf_data = _fill_template_pdf_with_data(report_data)
-        
-        logging.error(f"✅ PDF generated! Size: {len(pdf_data)} bytes")
         filename = f"{dr_number.replace('/', '_').replace(':', '_')}.pdf"
-        logging.error(f"📄 ==================== PDF GENERATION END ====================")
-        logging.error(f"📄 Filename: {filename}")
+        logging.debug(f"📄 PDF generated: {filename} ({len(pdf_data)} bytes)")
         
         # Preview: inline (abre no browser) | Download: attachment (faz download)
         disposition = "inline" if preview else "attachment"
@@ -23218,6 +23970,7 @@ def _get_next_dr_number(existing_conn=None):
         logging.info("🔄 Verificando números DR eliminados disponíveis para reciclagem...")
         
         if is_postgres:
+            # FOR UPDATE: o número reciclado fica reservado até o caller gravar o DR (mesma transação)
             cur = conn.cursor()
             cur.execute("""
                 SELECT dr_number 
@@ -23226,6 +23979,7 @@ def _get_next_dr_number(existing_conn=None):
                   AND EXTRACT(YEAR FROM deleted_at) = %s
                 ORDER BY dr_number 
                 LIMIT 1
+                FOR UPDATE SKIP LOCKED
             """, (current_year,))
             deleted_dr = cur.fetchone()
             cur.close()
@@ -23248,87 +24002,46 @@ def _get_next_dr_number(existing_conn=None):
         logging.info("✨ Nenhum número eliminado disponível - Gerando novo número sequencial")
         
         # 2. FALLBACK: Gerar novo número sequencial
-        # Obter configuração atual
+        # Um só UPDATE incrementa (ou faz o reset anual) e lê o número: no PostgreSQL o
+        # _db_lock não serializa (DBGate), por isso não pode haver SELECT + UPDATE separados.
+        now_iso = datetime.now().isoformat()
         if is_postgres:
             cur = conn.cursor()
             cur.execute("""
-                SELECT current_year, current_number, prefix 
-                FROM damage_report_numbering 
+                INSERT INTO damage_report_numbering (id, current_year, current_number, prefix)
+                VALUES (1, %s, 0, 'DR')
+                ON CONFLICT (id) DO NOTHING
+            """, (current_year,))
+            cur.execute("""
+                UPDATE damage_report_numbering
+                SET current_number = CASE WHEN current_year < %s THEN 1 ELSE current_number + 1 END,
+                    current_year = CASE WHEN current_year < %s THEN %s ELSE current_year END,
+                    updated_at = %s
                 WHERE id = 1
-            """)
-            row = cur.fetchone()
+                RETURNING current_number, prefix
+            """, (current_year, current_year, current_year, now_iso))
+            new_number, prefix = cur.fetchone()
+            conn.commit()
             cur.close()
         else:
-            cursor = conn.execute("""
-                SELECT current_year, current_number, prefix 
-                FROM damage_report_numbering 
+            conn.execute("""
+                INSERT INTO damage_report_numbering (id, current_year, current_number, prefix)
+                VALUES (1, ?, 0, 'DR')
+                ON CONFLICT (id) DO NOTHING
+            """, (current_year,))
+            # O UPDATE fica com o lock de escrita do SQLite até ao commit: a leitura a seguir é a nossa
+            conn.execute("""
+                UPDATE damage_report_numbering
+                SET current_number = CASE WHEN current_year < ? THEN 1 ELSE current_number + 1 END,
+                    current_year = CASE WHEN current_year < ? THEN ? ELSE current_year END,
+                    updated_at = ?
                 WHERE id = 1
-            """)
-            row = cursor.fetchone()
-        
-        if not row:
-            # Criar configuração inicial APENAS se não existir
-            if is_postgres:
-                cur = conn.cursor()
-                cur.execute("""
-                    INSERT INTO damage_report_numbering (id, current_year, current_number, prefix)
-                    SELECT 1, %s, 1, 'DR'
-                    WHERE NOT EXISTS (SELECT 1 FROM damage_report_numbering WHERE id = 1)
-                """, (current_year,))
-                conn.commit()
-                cur.close()
-            else:
-                conn.execute("""
-                    INSERT INTO damage_report_numbering (id, current_year, current_number, prefix)
-                    SELECT 1, ?, 1, 'DR'
-                    WHERE NOT EXISTS (SELECT 1 FROM damage_report_numbering WHERE id = 1)
-                """, (current_year,))
-                conn.commit()
-            return f"DR01/{current_year}"
-        
-        saved_year, current_number, prefix = row
-        
-        # Verificar se mudou o ano (reset)
-        if current_year > saved_year:
-            # Novo ano - reset para 01
-            new_number = 1
-            if is_postgres:
-                cur = conn.cursor()
-                cur.execute("""
-                    UPDATE damage_report_numbering 
-                    SET current_year = %s, current_number = %s, updated_at = %s
-                    WHERE id = 1
-                """, (current_year, new_number, datetime.now().isoformat()))
-                conn.commit()
-                cur.close()
-            else:
-                conn.execute("""
-                    UPDATE damage_report_numbering 
-                    SET current_year = ?, current_number = ?, updated_at = ?
-                    WHERE id = 1
-                """, (current_year, new_number, datetime.now().isoformat()))
-                conn.commit()
-            return f"{prefix}{new_number:02d}/{current_year}"
-        else:
-            # Mesmo ano - incrementar
-            new_number = current_number + 1
-            if is_postgres:
-                cur = conn.cursor()
-                cur.execute("""
-                    UPDATE damage_report_numbering 
-                    SET current_number = %s, updated_at = %s
-                    WHERE id = 1
-                """, (new_number, datetime.now().isoformat()))
-                conn.commit()
-                cur.close()
-            else:
-                conn.execute("""
-                    UPDATE damage_report_numbering 
-                    SET current_number = ?, updated_at = ?
-                    WHERE id = 1
-                """, (new_number, datetime.now().isoformat()))
-                conn.commit()
-            return f"{prefix}{new_number:02d}/{current_year}"
+            """, (current_year, current_year, current_year, now_iso))
+            new_number, prefix = conn.execute(
+                "SELECT current_number, prefix FROM damage_report_numbering WHERE id = 1"
+            ).fetchone()
+            conn.commit()
+        return f"{prefix or 'DR'}{new_number:02d}/{current_year}"
     finally:
         # Fechar e liberar lock apenas se criamos a conexão aqui
         if should_close:
@@ -25011,1118 +25724,365 @@ async def save_damage_report_coordinates(request: Request):
                             field_type,
                             template_version,
                             datetime.now().isoformat()
-                        ))
-                        
-                        conn.execute("""
-                            INSERT INTO damage_report_mapping_history 
-                            (template_version, field_id, x, y, width, height, page, field_type, mapped_by, mapped_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (
-                            template_version,
-                            field_id,
-                            coord.get('x'),
-                            coord.get('y'),
-                            coord.get('width'),
-                            coord.get('height'),
-                            coord.get('page', 1),
-                            field_type,
-                            username,
-                            datetime.now().isoformat()
-                        ))
-                
-                conn.commit()
-                logging.info(f"✅ SAVE: {len(coordinates)} coordenadas guardadas na BD (versão {template_version})")
-            finally:
-                conn.close()
-        
-        # Guardar também em ficheiro JSON (backup) - converter array para objeto para compatibilidade
-        backup_coords = {}
-        for coord in coordinates:
-            field_id = coord.get('field_id')
-            if field_id:
-                # Se já existe field_id, criar chave composta
-                page = coord.get('page', 1)
-                key = f"{field_id}@page{page}" if field_id in backup_coords else field_id
-                backup_coords[key] = coord
-        
-        with open('damage_report_coordinates.json', 'w') as f:
-            json.dump(backup_coords, f, indent=2)
-        
-        return {"ok": True, "count": len(coordinates), "version": template_version}
-    except Exception as e:
-        logging.error(f"Error saving coordinates: {e}")
-        return {"ok": False, "error": str(e)}
-
-def _validate_image_data(image_data: str, field_id: str = "unknown") -> bool:
-    """Valida se dados de imagem são válidos"""
-    is_diagram = 'diagram' in field_id.lower() or 'croqui' in field_id.lower()
-    log_fn = logging.error if is_diagram else logging.info
-    
-    try:
-        if not image_data:
-            logging.error(f"❌ [{field_id}] Image validation: empty data")
-            return False
-        
-        if not isinstance(image_data, str):
-            logging.error(f"❌ [{field_id}] Image validation: not a string, type={type(image_data)}")
-            return False
-        
-        # Remove prefix if present
-        has_prefix = ',' in image_data
-        img_data = image_data.split(',')[1] if has_prefix else image_data
-        
-        log_fn(f"🔍 [{field_id}] Validating: total={len(image_data)} chars, prefix={'✅' if has_prefix else '❌'}, base64={len(img_data)} chars")
-        
-        if len(img_data) < 100:
-            logging.error(f"❌ [{field_id}] Image validation: too short ({len(img_data)} chars)")
-            return False
-        
-        # Try to decode
-        img_bytes = base64.b64decode(img_data)
-        log_fn(f"🔍 [{field_id}] Base64 decoded: {len(img_bytes)} bytes")
-        
-        # Try to open with PIL
-        from PIL import Image
-        from io import BytesIO
-        img = Image.open(BytesIO(img_bytes))
-        
-        # Check minimum size
-        if img.width < 10 or img.height < 10:
-            logging.error(f"❌ [{field_id}] Image validation: too small ({img.width}x{img.height})")
-            return False
-        
-        log_fn(f"✅ [{field_id}] Image valid: {img.width}x{img.height}, {img.format}")
-        return True
-    except Exception as e:
-        logging.error(f"❌ [{field_id}] Image validation failed: {str(e)}")
-        return False
-
-def _validate_table_data(table_data) -> bool:
-    """Valida estrutura da tabela de reparações"""
-    try:
-        if not table_data:
-            return False
-        
-        if isinstance(table_data, str):
-            import json
-            table_data = json.loads(table_data)
-        
-        if not isinstance(table_data, list):
-            return False
-        
-        # Check each row has required fields
-        for row in table_data:
-            if not isinstance(row, dict):
-                return False
-            # Must have at least 'description'
-            if 'description' not in row:
-                return False
-        
-        return True
-    except:
-        return False
-
-def _format_currency(value) -> str:
-    """Formata valor como moeda portuguesa (120,00) - SEM € pois já está no template"""
-    try:
-        # Convert to float
-        if isinstance(value, str):
-            value = float(value.replace(',', '.').replace('€', '').strip())
-        
-        # Format with thousands separator and 2 decimals - SEM símbolo €
-        return f"{value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-    except:
-        return str(value)
-
-def _format_date(value) -> str:
-    """Formata data como dd/mm/yyyy"""
-    try:
-        from datetime import datetime
-        
-        if not value:
-            return ''
-        
-        # Try to parse various formats
-        for fmt in ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d']:
-            try:
-                dt = datetime.strptime(str(value), fmt)
-                return dt.strftime('%d/%m/%Y')
-            except:
-                continue
-        
-        return str(value)
-    except:
-        return str(value)
-
-def _format_number(value) -> str:
-    """Formata número com separadores de milhar"""
-    try:
-        if isinstance(value, str):
-            value = float(value.replace(',', '.').strip())
-        
-        # Format with thousands separator
-        return f"{value:,.0f}".replace(',', '.')
-    except:
-        return str(value)
-
-def _format_hours(value) -> str:
-    """Formata horas SEM casas decimais"""
-    try:
-        if isinstance(value, str):
-            value = float(value.replace(',', '.').strip())
-        
-        # Sem casas decimais para horas
-        return f"{int(value)}"
-    except:
-        return str(value)
-
-def _get_field_style(field_id: str) -> dict:
-    """
-    Retorna estilo customizado para o campo
-    Retorna: {'font': str, 'size': int, 'color': tuple, 'bold': bool, 'italic': bool}
-    """
-    field_id_lower = field_id.lower()
-    
-    # Default style - Arial 8pt, sem negrito ou itálico
-    style = {
-        'font': 'Helvetica',  # ReportLab usa Helvetica (similar a Arial)
-        'size': 8,
-        'color': (0, 0, 0),  # RGB black
-        'bold': False,
-        'italic': False
-    }
-    
-    # EXCEÇÕES:
-    # DR number e RA number (contract) ficam em negrito
-    if any(word in field_id_lower for word in ['dr_number', 'contract_number', 'contractnumber']):
-        style['bold'] = True
-    
-    # Total da reparação: 9pt bold
-    if any(word in field_id_lower for word in ['total_repair', 'totalrepair', 'total_cost', 'totalcost']):
-        style['size'] = 9
-        style['bold'] = True
-    
-    return style
-
-def _detect_field_type(field_id: str) -> str:
-    """
-    Detecta o tipo de campo baseado no field_id
-    Retorna: 'text', 'image', 'signature', 'table', 'images', 'currency', 'date', 'number', 'hours'
-    """
-    field_id_lower = field_id.lower()
-    
-    if 'signature' in field_id_lower or 'sign' in field_id_lower:
-        return 'signature'
-    elif 'photo' in field_id_lower or 'image' in field_id_lower or 'croqui' in field_id_lower or 'diagram' in field_id_lower:
-        return 'image'
-    elif field_id_lower == 'repair_items' or field_id_lower == 'table_repair':
-        # Apenas repair_items (JSON array) é tabela - repair_line_X são campos individuais
-        return 'table'
-    elif 'images' in field_id_lower:
-        return 'images'
-    elif 'hours' in field_id_lower or 'hour' in field_id_lower:
-        return 'hours'  # ✅ TIPO SEPARADO para horas (sem decimais)
-    elif any(word in field_id_lower for word in ['cost', 'price', 'total', 'subtotal']):
-        return 'currency'
-    elif 'date' in field_id_lower:
-        return 'date'
-    elif any(word in field_id_lower for word in ['km', 'quantity', 'qty', 'number']) and not any(exclude in field_id_lower for exclude in ['contract', 'dr_number', 'ra_number', 'phone']):
-        return 'number'
-    else:
-        return 'text'
-
-def _calculate_centered_y(y, height, font_size):
-    """
-    Calcula a posição Y para centralizar verticalmente o texto na caixa
-    y: posição Y da caixa (inferior)
-    height: altura da caixa
-    font_size: tamanho da fonte
-    """
-    # ReportLab desenha texto a partir da baseline
-    # Para centralizar: y + (height / 2) - (font_size / 3)
-    return y + (height / 2) - (font_size / 3)
-
-def _fill_template_pdf_with_data(report_data: dict) -> bytes:
-    """
-    Preenche o template PDF ativo com dados usando coordenadas mapeadas
-    Suporta: texto, imagens, tabelas, assinaturas
-    Retorna PDF preenchido como bytes
-    """
-    try:
-        from PyPDF2 import PdfReader, PdfWriter
-        from reportlab.pdfgen import canvas as rl_canvas
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.colors import black, grey
-        from reportlab.lib.utils import ImageReader
-        from io import BytesIO
-        from PIL import Image
-        import base64
-        import json
-        
-        # LOG: Dados recebidos
-        logging.info("="*80)
-        logging.info("🔍 PDF FILL - Report data received:")
-        logging.info(f"   date: {report_data.get('date', 'MISSING')}")
-        logging.info(f"   inspection_date: {report_data.get('inspection_date', 'MISSING')}")
-        logging.info(f"   dr_number: '{report_data.get('dr_number', 'MISSING')}'")
-        logging.info(f"   ra_number: '{report_data.get('ra_number', 'MISSING')}'")
-        logging.info(f"   contract_number: '{report_data.get('contract_number', 'MISSING')}'")
-        logging.info(f"   contractNumber: '{report_data.get('contractNumber', 'MISSING')}'")
-        logging.info(f"   vehicle_diagram: {'PRESENT (' + str(len(report_data.get('vehicle_diagram', ''))) + ' chars)' if report_data.get('vehicle_diagram') else 'MISSING'}")
-        
-        # Log TODAS as chaves com "diagram" ou "pin"
-        diagram_keys = [k for k in report_data.keys() if 'diagram' in k.lower() or 'pin' in k.lower()]
-        logging.info(f"   Keys com diagram/pin: {diagram_keys}")
-        for key in diagram_keys:
-            val = report_data.get(key, '')
-            logging.info(f"      {key}: {type(val).__name__}, len={len(str(val)) if val else 0}")
-        
-        pins_check = report_data.get('damage_pins') or report_data.get('damageDiagramData') or report_data.get('damage_diagram_data')
-        logging.info(f"   damage_pins/damageDiagramData: {'FOUND' if pins_check else 'MISSING'}")
-        if pins_check:
-            logging.info(f"      Pins data: {str(pins_check)[:200]}...")
-        logging.info("="*80)
-        
-        # 1. Carregar template ativo da BD
-        with _db_lock:
-            conn = _db_connect()
-            try:
-                is_postgres = False
-                if conn.__class__.__module__ == 'psycopg2.extensions':
-                    is_postgres = True
-                
-                if is_postgres:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT file_data FROM damage_report_templates 
-                        WHERE is_active = 1 
-                        ORDER BY version DESC LIMIT 1
-                    """)
-                    row = cursor.fetchone()
-                    cursor.close()
-                else:
-                    cursor = conn.execute("""
-                        SELECT file_data FROM damage_report_templates 
-                        WHERE is_active = 1 
-                        ORDER BY version DESC LIMIT 1
-                    """)
-                    row = cursor.fetchone()
-                
-                if not row or not row[0]:
-                    # Fallback: usar arquivo físico
-                    with open('Damage Report.pdf', 'rb') as f:
-                        template_data = f.read()
-                else:
-                    template_data = row[0]
-                    # Convert memoryview to bytes if needed (PostgreSQL returns memoryview)
-                    if isinstance(template_data, memoryview):
-                        template_data = bytes(template_data)
-            finally:
-                conn.close()
-        
-        # 2. Carregar coordenadas mapeadas
-        with _db_lock:
-            conn = _db_connect()
-            try:
-                if conn.__class__.__module__ == 'psycopg2.extensions':
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT field_id, x, y, width, height, page 
-                        FROM damage_report_coordinates
-                        ORDER BY field_id
-                    """)
-                    rows = cursor.fetchall()
-                    cursor.close()
-                else:
-                    cursor = conn.execute("""
-                        SELECT field_id, x, y, width, height, page 
-                        FROM damage_report_coordinates
-                        ORDER BY field_id
-                    """)
-                    rows = cursor.fetchall()
-                
-                # Suportar mesmo field_id em múltiplas páginas usando chave composta
-                coordinates = {}
-                for row in rows:
-                    field_id, x, y, width, height, page = row
-                    page_num = int(page) if page else 1
-                    
-                    # Chave composta: field_id@pageN para múltiplas páginas
-                    key = f"{field_id}@page{page_num}"
-                    
-                    coordinates[key] = {
-                        'field_id': field_id,  # Original field_id para buscar valor
-                        'x': float(x),
-                        'y': float(y),
-                        'width': float(width),
-                        'height': float(height),
-                        'page': page_num
-                    }
-            finally:
-                conn.close()
-        
-        # 3. Ler template PDF
-        template_pdf = PdfReader(BytesIO(template_data))
-        output_pdf = PdfWriter()
-        
-        # 4. Para cada página do template
-        # SUPORTE A MÚLTIPLAS PÁGINAS:
-        # - Cada campo tem coords['page'] (1-indexed)
-        # - Loop processa todas as páginas do template
-        # - Campos são renderizados apenas na página correta
-        # - Tabelas grandes podem span múltiplas páginas (mapeando campo por página)
-        # - Grid de fotos pode ser distribuído em várias páginas
-        num_pages = len(template_pdf.pages)
-        
-        for page_num in range(num_pages):
-            page = template_pdf.pages[page_num]
-            page_width = float(page.mediabox.width)
-            page_height = float(page.mediabox.height)
-            
-            # Criar overlay com texto para esta página
-            packet = BytesIO()
-            can = rl_canvas.Canvas(packet, pagesize=(page_width, page_height))
-            can.setFont("Helvetica", 8)
-            
-            # Preencher campos desta página
-            for composite_key, coords in coordinates.items():
-                # MULTI-PAGE FILTER: Skip se campo não pertence a esta página
-                if coords['page'] != (page_num + 1):
-                    continue
-                
-                # Extrair field_id original da coordenada
-                field_id = coords['field_id']
-                
-                # FIELD NAME ALIASES: Mapear snake_case (BD) → camelCase (report_data)
-                # Necessário porque coordenadas usam snake_case mas report_data tem camelCase
-                field_aliases = {
-                    'ra_number': 'ra_number',  # ✅ RA Number (mesmo nome)
-                    'contract_number': 'contractNumber',
-                    'dr_number': 'dr_number',  # ✅ DR Number (mesmo nome)
-                    'vehicle_diagram': 'vehicle_diagram',  # ✅ Croqui (mesmo nome)
-                    'vehicleDiagram': 'vehicle_diagram',  # ✅ Alias camelCase → snake_case
-                    'damage_pins': 'damage_pins',  # ✅ Pins do diagrama
-                    'customer_name': 'clientName',
-                    'customer_email': 'clientEmail',
-                    'customer_phone': 'clientPhone',
-                    'customer_address': 'address',
-                    'customer_postal': 'customer_postal',  # ✅ Código Postal + Cidade (campo combinado)
-                    'postalCodeCity': 'customer_postal',  # ✅ Alias do form
-                    'customer_city': 'city',
-                    'customer_country': 'country',
-                    'vehicle_plate': 'vehiclePlate',
-                    'vehicle_brand': 'vehicleBrand',
-                    'vehicle_model': 'vehicleModel',
-                    'vehicle_brand_model': 'vehicleBrandModel',  # ✅ Campo combinado Marca / Modelo
-                    'vehicleBrandModel': 'vehicleBrandModel',  # ✅ Alias direto
-                    'vehicle_color': 'vehicleColor',
-                    'vehicle_km': 'vehicleKm',
-                    'pickup_date': 'pickupDate',  # ✅ Data FORMATADA dd-mm-yyyy
-                    'pickup_time': 'pickupTime',
-                    'pickup_location': 'pickupLocation',
-                    'return_date': 'returnDate',  # ✅ Data FORMATADA dd-mm-yyyy
-                    'return_time': 'returnTime',
-                    'return_location': 'returnLocation',
-                    'total_amount': 'total_amount',  # ✅ Total da reparação
-                    'total_repair_cost': 'total_amount',  # ✅ Alias
-                    'totalRepairCost': 'total_amount',  # ✅ Alias camelCase
-                    'inspector_name': 'inspector_name',  # ✅ Mantido para compatibilidade
-                    'issued_by': 'issued_by',  # ✅ Colaborador (alias)
-                    'inspection_date': 'inspection_date',
-                }
-                
-                # NOTA: vehicle_diagram e damage_photo_X já batem (ambos com underscore)
-                # NOTA: damage_description_line_X precisa mapear para damage_X
-                for i in range(1, 16):
-                    field_aliases[f'damage_description_line_{i}'] = f'damage_{i}'
-                
-                # Obter valor do campo (tentar field_id direto primeiro, depois alias)
-                value = report_data.get(field_id, '')
-                alias_used = None
-                if not value and field_id in field_aliases:
-                    alias_key = field_aliases[field_id]
-                    value = report_data.get(alias_key, '')
-                    if value:
-                        alias_used = alias_key
-                
-                # LOG ESPECIAL para vehicle_diagram/vehicleDiagram
-                if 'diagram' in field_id.lower() and 'vehicle' in field_id.lower():
-                    logging.info(f"🔍 Processing {field_id}:")
-                    logging.info(f"   Direct lookup (field_id='{field_id}'): {'FOUND' if report_data.get(field_id) else 'NOT FOUND'}")
-                    if field_id in field_aliases:
-                        alias_key = field_aliases[field_id]
-                        logging.info(f"   Alias lookup (alias='{alias_key}'): {'FOUND' if report_data.get(alias_key) else 'NOT FOUND'}")
-                    logging.info(f"   Final value: {'FOUND (' + str(len(str(value))) + ' chars)' if value else 'NOT FOUND'}")
-                
-                # Log detalhado para campos importantes
-                is_important = any(keyword in field_id.lower() for keyword in ['diagram', 'photo', 'signature', 'dr_number', 'ra_number', 'date', 'quantity', 'pin'])
-                if is_important:
-                    logging.info(f"🔍 Campo: {field_id} (page {coords['page']}) | Type: {field_type}")
-                    logging.info(f"   Alias usado: {alias_used if alias_used else 'N/A'}")
-                    logging.info(f"   Tem valor? {bool(value)} | Tamanho: {len(str(value)) if value else 0}")
-                    if value:
-                        preview = str(value)[:80] if not isinstance(value, list) else f"[{len(value)} items]"
-                        logging.info(f"   Preview: {preview}")
-                    else:
-                        # Verificar se existe em report_data com outro nome
-                        if 'diagram' in field_id.lower() or 'pin' in field_id.lower():
-                            possible_keys = [k for k in report_data.keys() if 'diagram' in k.lower() or 'pin' in k.lower()]
-                            logging.info(f"   ⚠️ VAZIO! Chaves disponíveis: {possible_keys}")
-                        if 'date' in field_id.lower():
-                            date_keys = [k for k in report_data.keys() if 'date' in k.lower()]
-                            logging.info(f"   ⚠️ VAZIO! Chaves com 'date': {date_keys}")
-                
-                if not value:
-                    if is_important:
-                        logging.warning(f"⚠️ Skipping {field_id} - sem valor")
-                    continue
-                
-                # Detectar tipo de campo (ANTES de converter coordenadas para usar nos logs)
-                field_type = _detect_field_type(field_id)
-                
-                # ✅ EXTRAIR COORDENADAS DO DICIONÁRIO
-                x = coords['x']
-                y = page_height - coords['y'] - coords['height']  # Transform Y coordinate
-                width = coords['width']
-                height = coords['height']
-                
-                # ✅ NÃO EXPANDIR DIAGRAMA - usar tamanho EXATO do mapeamento (preview)
-                # Os pins já estão na imagem capturada pelo html2canvas
-                is_diagram = 'diagram' in field_id.lower() or 'croqui' in field_id.lower()
-                # EXPANSÃO DESATIVADA - causar desalinhamento dos pins
-                # if is_diagram and field_type == 'image':
-                #     expansion_factor = 1.20
-                #     ...
-                # Usar coordenadas EXATAS do mapeamento
-                
-                # LOG PRÉ-TRANSFORMAÇÃO (para diagrama)
-                is_diagram_check = 'diagram' in field_id.lower() or 'croqui' in field_id.lower()
-                if is_diagram_check:
-                    logging.error(f"🖼️🖼️🖼️ TENTANDO DESENHAR CROQUI: {field_id}")
-                    logging.error(f"   Valor tem {len(str(value))} chars")
-                    logging.error(f"   Coords ORIGINAIS (DB): x={coords['x']}, y={coords['y']}, w={coords['width']}, h={coords['height']}")
-                    logging.error(f"   page_height={page_height}")
-                    logging.error(f"   Coords TRANSFORMADAS: x={x}, y={y}, w={width}, h={height}")
-                
-                # IMAGEM ou ASSINATURA - processar TODOS os campos do tipo 'image'
-                if field_type == 'image' or field_type == 'signature':
-                    # VALIDAÇÃO
-                    if is_diagram_check:
-                        logging.error("🖼️ Chamando validação...")
-                    
-                    is_valid = _validate_image_data(value, field_id)
-                    
-                    if is_diagram_check:
-                        logging.error(f"🖼️ Validação retornou: {is_valid}")
-                    
-                    if not is_valid:
-                        if is_diagram_check:
-                            logging.error("🖼️ VALIDAÇÃO FALHOU! Desenhando placeholder...")
-                        logging.warning(f"Invalid image data for {field_id}, drawing placeholder")
-                        can.setStrokeColor(grey)
-                        can.setFillColor(grey)
-                        can.rect(x, y, width, height, stroke=1, fill=0)
-                        can.setFont("Helvetica", 6)
-                        can.drawString(x + 2, y + height/2, "[Invalid Image]")
-                        continue
-                    
-                    try:
-                        if is_diagram_check:
-                            logging.error("🖼️ VALIDAÇÃO OK! Começando processamento...")
-                        
-                        # Decode base64 image
-                        if isinstance(value, str) and ('data:image' in value or value.startswith('/9j')):
-                            if is_diagram_check:
-                                logging.error(f"🖼️ Decodificando base64 ({len(value)} chars)...")
-                            
-                            # Remove data:image prefix if present
-                            img_data = value.split(',')[1] if ',' in value else value
-                            img_bytes = base64.b64decode(img_data)
-                            
-                            if is_diagram_check:
-                                logging.error(f"🖼️ Decodificado: {len(img_bytes)} bytes. Abrindo com PIL...")
-                            
-                            # Load image with PIL
-                            img = Image.open(BytesIO(img_bytes))
-                            
-                            # Convert to RGB if needed (EXCETO para diagrama - manter transparência)
-                            is_diagram = 'diagram' in field_id.lower() or 'croqui' in field_id.lower()
-                            
-                            if is_diagram_check:
-                                logging.error(f"🖼️ Imagem aberta: {img.mode}, {img.size}")
-                            
-                            logging.info(f"🔍 {field_id}: is_diagram={is_diagram}, mode={img.mode}, size={img.size}")
-                            
-                            if not is_diagram and img.mode in ('RGBA', 'LA', 'P'):
-                                # Fotos normais: converter para RGB com fundo branco
-                                background = Image.new('RGB', img.size, (255, 255, 255))
-                                if img.mode == 'P':
-                                    img = img.convert('RGBA')
-                                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                                img = background
-                            elif is_diagram:
-                                if is_diagram_check:
-                                    logging.error(f"🖼️ É diagrama! Removendo fundo branco...")
-                                
-                                # Diagrama: REMOVER fundo branco e garantir transparência (SEM NUMPY)
-                                if img.mode != 'RGBA':
-                                    img = img.convert('RGBA')
-                                
-                                # Usar PIL para remover fundo branco (sem numpy)
-                                pixels = img.load()
-                                width_img, height_img = img.size
-                                
-                                # Threshold para considerar "branco" (RGB > 240)
-                                threshold = 240
-                                
-                                # ✅ FIX: Usar nomes diferentes (px_x, px_y) para não sobrescrever as coordenadas do campo
-                                for px_y in range(height_img):
-                                    for px_x in range(width_img):
-                                        r, g, b, a = pixels[px_x, px_y]
-                                        # Se pixel é branco/claro, tornar transparente
-                                        if r > threshold and g > threshold and b > threshold:
-                                            pixels[px_x, px_y] = (r, g, b, 0)  # Alpha = 0
-                                
-                                if is_diagram_check:
-                                    logging.error(f"🖼️ Fundo branco removido!")
-                                
-                                logging.info(f"✅ Diagrama: fundo branco removido, mantém transparência (RGBA) - PIL only")
-                            
-                            # Save to BytesIO for ReportLab
-                            img_buffer = BytesIO()
-                            if is_diagram and img.mode == 'RGBA':
-                                # Diagrama com transparência: usar PNG
-                                img.save(img_buffer, format='PNG')
-                            else:
-                                # Fotos normais: usar JPEG
-                                img.save(img_buffer, format='JPEG', quality=85)
-                            img_buffer.seek(0)
-                            
-                            # DIAGRAMA: usar CONTAIN (sem crop) | FOTOS: usar COVER (com crop)
-                            img_width, img_height = img.size
-                            
-                            # Variáveis para posição final do diagrama (para pins)
-                            diagram_final_x, diagram_final_y = x, y
-                            diagram_final_width, diagram_final_height = width, height
-                            
-                            # ✅ is_diagram já foi definido acima (linha 18391)
-                            if is_diagram:
-                                # DIAGRAMA: USAR TAMANHO EXATO DA BOX MAPEADA
-                                # Box: X=25, Y=254, W=256, H=201 (página 1)
-                                # Limite direito: X=318 (início das descrições)
-                                # SOLUÇÃO: Desenhar EXATAMENTE no tamanho mapeado
-                                
-                                if is_diagram_check:
-                                    logging.error(f"🖼️ MODO DIAGRAMA - TAMANHO EXATO DA BOX")
-                                    logging.error(f"🖼️ Box mapeada: x={x}, y={y}, w={width}, h={height}")
-                                    logging.error(f"🖼️ Imagem capturada: {img_width}x{img_height}")
-                                
-                                # ✅ ESCALAR IMAGEM CAPTURADA PARA CABER NA BOX
-                                # Frontend captura em ~500px (boa qualidade)
-                                # Backend escala para 256×201px mantendo aspect ratio
-                                
-                                # Calcular escala para caber na box mantendo proporção
-                                img_ratio = img_width / img_height
-                                box_ratio = width / height
-                                
-                                if is_diagram_check:
-                                    logging.error(f"🖼️ Imagem capturada: {img_width}×{img_height} (ratio {img_ratio:.3f})")
-                                    logging.error(f"🖼️ Box PDF: {int(width)}×{int(height)} (ratio {box_ratio:.3f})")
-                                
-                                # Escalar mantendo aspect ratio (fit dentro da box)
-                                if img_ratio > box_ratio:
-                                    # Imagem mais larga - limitar por largura
-                                    draw_width = width
-                                    draw_height = width / img_ratio
-                                    draw_x = x
-                                    draw_y = y + (height - draw_height) / 2  # Centralizar verticalmente
-                                else:
-                                    # Imagem mais alta - limitar por altura
-                                    draw_height = height
-                                    draw_width = height * img_ratio
-                                    draw_x = x + (width - draw_width) / 2  # Centralizar horizontalmente
-                                    draw_y = y
-                                
-                                if is_diagram_check:
-                                    logging.error(f"🖼️ Desenhar escalado: ({int(draw_x)}, {int(draw_y)}) {int(draw_width)}×{int(draw_height)}")
-                                
-                                # Desenhar diagrama escalado mantendo proporção
-                                logging.error(f"🖼️ Preparando buffer PNG para {field_id}...")
-                                img_buffer = BytesIO()
-                                img.save(img_buffer, format='PNG')
-                                img_buffer.seek(0)
-                                
-                                logging.error(f"🖼️ Chamando can.drawImage em ({int(draw_x)}, {int(draw_y)}, {int(draw_width)}×{int(draw_height)})...")
-                                can.drawImage(
-                                    ImageReader(img_buffer),
-                                    draw_x, draw_y,
-                                    width=draw_width,
-                                    height=draw_height,
-                                    preserveAspectRatio=True,
-                                    mask='auto'
-                                )
-                                logging.error(f"🖼️✅ DIAGRAMA DESENHADO COM SUCESSO! {field_id}")
-                                logging.info(f"✅ Drew diagram {field_id} ({int(img_width)}×{int(img_height)} → {int(draw_width)}×{int(draw_height)})")
-                                
-                                # 🎯 NÃO DESENHAR PINS - A imagem vehicleDiagram do frontend JÁ TEM os pins desenhados!
-                                # O frontend captura o croqui com html2canvas com os pins já visíveis
-                                # Se desenharmos novamente, ficam DUPLICADOS (como o user reportou!)
-                                # A posição dos números NOS PINS está correta no CSS (padding-top: 12px)
-                                pins_data_disabled = None  # Desativado para evitar duplicação
-                                if pins_data_disabled:  # Never executes - pins vêm na imagem!
-                                    try:
-                                        # Parse JSON se necessário
-                                        if isinstance(pins_data, str):
-                                            pins_array = json.loads(pins_data) if pins_data.startswith('[') else []
-                                        else:
-                                            pins_array = pins_data if isinstance(pins_data, list) else []
-                                        
-                                        if pins_array:
-                                            # ✅ FILTRAR pins desta vista (ou todos se view='all')
-                                            # Verificar se há pins com view específica (top/side) ou genérica (all)
-                                            has_view_filter = any(p.get('view') in ['top', 'side'] for p in pins_array)
-                                            
-                                            if has_view_filter:
-                                                # Sistema com múltiplas vistas - filtrar por vista
-                                                current_view = 'top' if field_id == 'vehicleDiagram' else 'side'
-                                                pins_for_this_view = [p for p in pins_array if p.get('view') == current_view]
-                                            else:
-                                                # Sistema com vista única 'all' - usar todos os pins
-                                                current_view = 'all'
-                                                pins_for_this_view = pins_array
-                                            
-                                            # ✅ CALCULAR ESCALA: Frontend → PDF
-                                            # Frontend: Container com imagem 986x700
-                                            # PDF: Desenho em draw_width x draw_height
-                                            scale_x = draw_width / img_width
-                                            scale_y = draw_height / img_height
-                                            
-                                            logging.error(f"🎯 DESENHANDO PINS PARA VISTA '{current_view}' (field_id={field_id})...")
-                                            logging.error(f"   📊 TOTAL PINS RECEBIDOS: {len(pins_array)}")
-                                            logging.error(f"   ✅ PINS DESTA VISTA ({current_view}): {len(pins_for_this_view)}")
-                                            for idx, p in enumerate(pins_for_this_view):
-                                                logging.error(f"      Pin {idx}: number={p.get('number')}, x={p.get('x')}, y={p.get('y')}, view={p.get('view')}, size={p.get('size')}")
-                                            logging.error(f"   📐 Diagrama PDF: x={draw_x:.1f}, y={draw_y:.1f}, w={draw_width:.1f}, h={draw_height:.1f}")
-                                            logging.error(f"   📐 Imagem original: {img_width}x{img_height}")
-                                            logging.error(f"   📐 Escala: scale_x={scale_x:.4f}, scale_y={scale_y:.4f}")
-                                            logging.error(f"   📐 Container frontend: {img_width}x{img_height} (onde os pins foram clicados)")
-                                            
-                                            # Carregar imagem do pin (40x56px no frontend)
-                                            pin_img_path = 'static/pin.png'
-                                            pin_img = Image.open(pin_img_path)
-                                            
-                                            # ✅ USAR APENAS PINS DESTA VISTA
-                                            for pin in pins_for_this_view:
-                                                pin_x_original = pin.get('x', 0)
-                                                pin_y_original = pin.get('y', 0)
-                                                pin_number = pin.get('number', 1)
-                                                pin_size = pin.get('size', 1)
-                                                
-                                                # ✅ TAMANHO DO PIN: Escalar com diagrama MAS garantir mínimo visível
-                                                # Frontend: 40x56px base × slider do utilizador
-                                                # PDF: Escalar pela mesma proporção do diagrama + mínimo de 20pt
-                                                pin_width_original = 40 * pin_size
-                                                pin_height_original = 56 * pin_size
-                                                
-                                                # ✅ Escalar com diagrama mas com MÍNIMO de 20pt largura (visibilidade)
-                                                pin_width_pdf = max(20, pin_width_original * scale_x)
-                                                pin_height_pdf = max(28, pin_height_original * scale_y)  # Manter aspect ratio 40:56
-                                                
-                                                # ✅ COORDENADAS DO CANVAS (986x700):
-                                                # Canvas JavaScript: Y=0 no TOPO, Y cresce para BAIXO
-                                                # PDF: Y=0 no FUNDO, Y cresce para CIMA
-                                                # As coordenadas do canvas já são convertidas no frontend!
-                                                
-                                                pin_x_scaled = draw_x + (pin_x_original * scale_x)
-                                                # ✅ INVERTER Y! 
-                                                # Canvas: Y=0 topo, cresce para baixo
-                                                # PDF: Y=0 fundo, cresce para cima
-                                                # draw_y = fundo do diagrama no PDF
-                                                # draw_y + draw_height = topo do diagrama no PDF
-                                                # Fórmula: bottom - offset_from_top
-                                                pin_y_scaled = draw_y + draw_height - (pin_y_original * scale_y)
-                                                
-                                                # 🔍 DEBUG: Verificar se pin está dentro do diagrama
-                                                logging.error(f"   🔍 Pin #{pin_number} DEBUG:")
-                                                logging.error(f"      Canvas: ({pin_x_original:.1f}, {pin_y_original:.1f})")
-                                                logging.error(f"      Escalado: ({pin_x_original * scale_x:.1f}, {pin_y_original * scale_y:.1f})")
-                                                logging.error(f"      PDF scaled: ({pin_x_scaled:.1f}, {pin_y_scaled:.1f})")
-                                                logging.error(f"      Diagrama range: X[{draw_x:.1f}, {draw_x + draw_width:.1f}] Y[{draw_y:.1f}, {draw_y + draw_height:.1f}]")
-                                                
-                                                # ✅ AJUSTE PARA MANTER PONTA DO PIN NA COORDENADA
-                                                # Imagem original: 165x219px
-                                                # Ponta visual está aproximadamente a 2% da altura a partir do fundo
-                                                # (pequena margem/transparência inferior)
-                                                pin_x_final = pin_x_scaled - (pin_width_pdf / 2)  # Centralizar horizontalmente
-                                                
-                                                # ✅ Subtrair margem inferior proporcional ao tamanho do pin
-                                                # Isto garante que a PONTA VISUAL fica sempre na mesma coordenada
-                                                # independentemente do tamanho do pin
-                                                pin_tip_offset = pin_height_pdf * 0.02  # 2% margem inferior
-                                                pin_y_final = pin_y_scaled - pin_tip_offset
-                                                
-                                                logging.error(f"      Final pos: ({pin_x_final:.1f}, {pin_y_final:.1f}) ← Ponta do pin (offset={pin_tip_offset:.1f})")
-                                                
-                                                # Desenhar imagem do pin
-                                                pin_buffer = BytesIO()
-                                                pin_img.save(pin_buffer, format='PNG')
-                                                pin_buffer.seek(0)
-                                                
-                                                can.drawImage(
-                                                    ImageReader(pin_buffer),
-                                                    pin_x_final, pin_y_final,
-                                                    width=pin_width_pdf,
-                                                    height=pin_height_pdf,
-                                                    mask='auto'
-                                                )
-                                                
-                                                # ✅ DESENHAR NÚMERO PRETO CENTRALIZADO NA BOLA DO PIN
-                                                can.setFillColorRGB(0, 0, 0)  # PRETO
-                                                
-                                                # Fonte proporcional ao pin (58% da largura - MAIOR, mínimo 10pt)
-                                                font_size = max(10, int(pin_width_pdf * 0.58))
-                                                can.setFont("Helvetica-Bold", font_size)  # BOLD
-                                                
-                                                # ✅ POSICIONAR NÚMERO IGUAL AO HTML (padding-top: 12px)
-                                                text_x = pin_x_scaled
-                                                
-                                                # CSS do HTML: padding-top: 12px significa que o número
-                                                # começa a 12px do TOPO do pin (height: 56px)
-                                                #
-                                                # No PDF, Y cresce de BAIXO para CIMA (invertido!)
-                                                # 12px do topo = (56px - 12px) = 44px do fundo
-                                                # 
-                                                # Mas padding-top é onde o TEXTO COMEÇA, não o centro!
-                                                # Com line-height: 24px, o centro fica a 12 + 12 = 24px do topo
-                                                # 24px do topo = 56 - 24 = 32px do fundo
-                                                # 
-                                                # Proporção: 32/56 = 0.5714 ESTÁ MUITO ALTO!
-                                                # Na prática visual, o centro da bola está mais baixo (~40%)
-                                                
-                                                # Testar 40% da altura (entre topo e meio)
-                                                text_y_base = pin_y_final + (pin_height_pdf * 0.40)
-                                                
-                                                # drawCentredString usa BASELINE, ajustar para cima
-                                                text_y = text_y_base + (font_size * 0.25)
-                                                
-                                                can.drawCentredString(text_x, text_y, str(pin_number))
-                                                
-                                                logging.error(f"   📍 Pin #{pin_number}:")
-                                                logging.error(f"      Frontend: ({pin_x_original:.0f}, {pin_y_original:.0f})  [clique do rato]")
-                                                logging.error(f"      Escalado: ({pin_x_original * scale_x:.1f}, {pin_y_original * scale_y:.1f})")
-                                                logging.error(f"      PDF pos:  ({pin_x_scaled:.1f}, {pin_y_scaled:.1f})  [após offset + inversão Y]")
-                                                logging.error(f"      Final:    ({pin_x_final:.1f}, {pin_y_final:.1f})  [ponta do pin]")
-                                                logging.error(f"      Size:     {pin_width_pdf:.1f}x{pin_height_pdf:.1f}  Font: {font_size}pt")
-                                            
-                                            logging.error(f"🎯✅ {len(pins_for_this_view)} PINS DESENHADOS PARA VISTA '{current_view}'!")
-                                        else:
-                                            logging.error("⚠️ Pins array está vazio")
-                                    except Exception as e:
-                                        logging.error(f"❌ Erro ao desenhar pins: {e}", exc_info=True)
-                                else:
-                                    logging.error("⚠️ Nenhum pin data encontrado")
-                            else:
-                                # FOTOS: COVER mode (preencher com crop)
-                                img_aspect = img_width / img_height
-                                box_aspect = width / height
-                                
-                                if img_aspect > box_aspect:
-                                    # Imagem mais larga: ajustar pela ALTURA
-                                    new_height = height
-                                    new_width = height * img_aspect
-                                else:
-                                    # Imagem mais alta: ajustar pela LARGURA
-                                    new_width = width
-                                    new_height = width / img_aspect
-                                
-                                # Redimensionar
-                                img_resized = img.resize((int(new_width), int(new_height)), Image.Resampling.LANCZOS)
-                                
-                                # Crop para caixa exata (center crop)
-                                if new_width > width:
-                                    left = (new_width - width) / 2
-                                    img_cropped = img_resized.crop((int(left), 0, int(left + width), int(new_height)))
-                                else:
-                                    top = (new_height - height) / 2
-                                    img_cropped = img_resized.crop((0, int(top), int(new_width), int(top + height)))
-                                
-                                # Save
-                                img_buffer = BytesIO()
-                                if img_cropped.mode == 'RGBA':
-                                    background = Image.new('RGB', img_cropped.size, (255, 255, 255))
-                                    background.paste(img_cropped, mask=img_cropped.split()[-1])
-                                    img_cropped = background
-                                img_cropped.save(img_buffer, format='JPEG', quality=90)
-                                img_buffer.seek(0)
-                                
-                                # Desenhar foto
-                                can.drawImage(
-                                    ImageReader(img_buffer),
-                                    x, y,
-                                    width=width,
-                                    height=height
-                                )
-                                logging.info(f"✅ Drew photo {field_id} (COVER mode: filled {int(width)}x{int(height)} box with crop)")
-                    except Exception as e:
-                        logging.error(f"Error drawing image {field_id}: {e}")
-                        # Fallback: draw placeholder
-                        can.setStrokeColor(grey)
-                        can.setFillColor(grey)
-                        can.rect(x, y, width, height, stroke=1, fill=0)
-                        can.setFont("Helvetica", 6)
-                        can.drawString(x + 2, y + height/2, "[Image]")
-                
-                elif field_type == 'table':
-                    # TABELA DE REPARAÇÕES (só repair_items é tabela!)
-                    # VALIDAÇÃO
-                    if not _validate_table_data(value):
-                        logging.warning(f"Invalid table data for {field_id}, drawing placeholder")
-                        can.setFont("Helvetica", 7)
-                        can.setFillColor(black)
-                        can.drawString(x + 2, y + 4, "[Invalid Table Data]")
-                        continue
-                    
-                    try:
-                        # Parse table data (JSON array)
-                        if isinstance(value, str):
-                            table_data = json.loads(value) if value.startswith('[') else []
-                        else:
-                            table_data = value if isinstance(value, list) else []
-                        
-                        if table_data:
-                            # Draw table grid
-                            can.setStrokeColor(black)
-                            can.setLineWidth(0.5)
-                            
-                            # Calculate row height
-                            num_rows = min(len(table_data), 10)  # Max 10 rows
-                            row_height = height / (num_rows + 1)  # +1 for header
-                            
-                            # Draw horizontal lines
-                            for i in range(num_rows + 2):
-                                line_y = y + (i * row_height)
-                                can.line(x, line_y, x + width, line_y)
-                            
-                            # Draw vertical lines (5 columns: desc, qty, hours, price, total)
-                            col_widths = [width * 0.35, width * 0.12, width * 0.13, width * 0.20, width * 0.20]
-                            col_x = x
-                            for col_width in col_widths:
-                                can.line(col_x, y, col_x, y + height)
-                                col_x += col_width
-                            can.line(col_x, y, col_x, y + height)  # Last line
-                            
-                            # Draw header (CENTRALIZADO VERTICALMENTE)
-                            can.setFont("Helvetica-Bold", 7)
-                            header_font_size = 7
-                            header_y_base = y + height - row_height
-                            header_y = _calculate_centered_y(header_y_base, row_height, header_font_size)
-                            can.drawString(x + 2, header_y, "Descrição")
-                            can.drawString(x + col_widths[0] + 2, header_y, "Qtd")
-                            can.drawString(x + col_widths[0] + col_widths[1] + 2, header_y, "Horas")
-                            can.drawString(x + col_widths[0] + col_widths[1] + col_widths[2] + 2, header_y, "Preço")
-                            can.drawString(x + col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3] + 2, header_y, "Total")
-                            
-                            # Draw rows with FORMATTING (CENTRALIZADO VERTICALMENTE)
-                            can.setFont("Helvetica", 6)
-                            row_font_size = 6
-                            for i, row in enumerate(table_data[:10]):
-                                row_y_base = y + height - ((i + 2) * row_height)
-                                row_y = _calculate_centered_y(row_y_base, row_height, row_font_size)
-                                
-                                # Description (truncated, left-aligned)
-                                can.drawString(x + 2, row_y, str(row.get('description', ''))[:30])
-                                
-                                # Quantity (number, center-aligned HORIZONTALMENTE)
-                                qty_value = row.get('quantity', row.get('qty', ''))
-                                qty_formatted = _format_number(qty_value) if qty_value else ''
-                                # Centro da coluna quantity
-                                qty_x = x + col_widths[0] + (col_widths[1] / 2)
-                                can.drawCentredString(qty_x, row_y, qty_formatted)
-                                logging.debug(f"   Qty: {qty_formatted} centered at x={qty_x}")
-                                
-                                # Hours (sem decimais, center-aligned)
-                                hours_value = row.get('hours', '')
-                                hours_formatted = _format_hours(hours_value) if hours_value else ''
-                                hours_x = x + col_widths[0] + col_widths[1] + (col_widths[2] / 2)
-                                can.drawCentredString(hours_x, row_y, hours_formatted)
-                                
-                                # Price (currency, right-aligned with € symbol)
-                                price_formatted = _format_currency(row.get('price', '')) if row.get('price') else ''
-                                price_x = x + col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3] - 5
-                                can.drawRightString(price_x, row_y, price_formatted)
-                                
-                                # Total (currency, right-aligned with € symbol)
-                                total_formatted = _format_currency(row.get('total', '')) if row.get('total') else ''
-                                total_x = x + col_widths[0] + col_widths[1] + col_widths[2] + col_widths[3] + col_widths[4] - 5
-                                can.drawRightString(total_x, row_y, total_formatted)
-                            
-                            logging.info(f"✅ Drew table for {field_id} with {len(table_data)} rows")
-                    except Exception as e:
-                        logging.error(f"Error drawing table {field_id}: {e}")
-                        # Fallback: draw text
-                        can.setFont("Helvetica", 8)
-                        can.setFillColor(black)
-                        text_y = _calculate_centered_y(y, height, 8)
-                        can.drawString(x + 2, text_y, str(value)[:50])
-                
-                elif field_type == 'currency':
-                    # MOEDA FORMATADA (alinhada à direita para € symbol do template)
-                    formatted_value = _format_currency(value)
-                    style = _get_field_style(field_id)
-                    
-                    # Apply style
-                    font_name = f"{style['font']}-Bold" if style['bold'] else style['font']
-                    font_name = f"{font_name}-Oblique" if style['italic'] and not style['bold'] else font_name
-                    can.setFont(font_name, style['size'])
-                    can.setFillColorRGB(*style['color'])
-                    
-                    text_y = _calculate_centered_y(y, height, style['size'])
-                    # Right-align para alinhar com símbolo € no template
-                    can.drawRightString(x + width - 5, text_y, formatted_value)
-                
-                elif field_type == 'date':
-                    # DATA FORMATADA
-                    logging.info(f"📅 DATE FIELD DETECTED: {field_id}")
-                    logging.info(f"   Raw value: '{value}' (type: {type(value).__name__})")
-                    logging.info(f"   Position: x={x}, y={y}, w={width}, h={height}")
-                    
-                    if not value or value == '':
-                        logging.warning(f"   ⚠️ DATE VALUE IS EMPTY! Skipping.")
-                        # Desenhar placeholder para debug
-                        can.setFont("Helvetica", 8)
-                        can.setFillColorRGB(1, 0, 0)  # Vermelho
-                        text_y = _calculate_centered_y(y, height, 8)
-                        can.drawString(x + 2, text_y, "[NO DATE]")
-                        continue
-                    
-                    formatted_value = _format_date(value)
-                    style = _get_field_style(field_id)
-                    
-                    logging.info(f"   Formatted: '{formatted_value}'")
-                    logging.info(f"   Style: font={style['font']}, size={style['size']}, color={style['color']}")
-                    
-                    # Apply style
-                    font_name = f"{style['font']}-Bold" if style['bold'] else style['font']
-                    font_name = f"{font_name}-Oblique" if style['italic'] and not style['bold'] else font_name
-                    can.setFont(font_name, style['size'])
-                    can.setFillColorRGB(*style['color'])
-                    
-                    text_y = _calculate_centered_y(y, height, style['size'])
-                    can.drawString(x + 2, text_y, formatted_value)
-                    logging.info(f"✅ DATE DRAWN at x={x + 2}, y={text_y} → '{formatted_value}'")
-                
-                elif field_type == 'number':
-                    # NÚMERO FORMATADO
-                    formatted_value = _format_number(value)
-                    style = _get_field_style(field_id)
-                    
-                    # Apply style
-                    font_name = f"{style['font']}-Bold" if style['bold'] else style['font']
-                    font_name = f"{font_name}-Oblique" if style['italic'] and not style['bold'] else font_name
-                    can.setFont(font_name, style['size'])
-                    can.setFillColorRGB(*style['color'])
-                    
-                    text_y = _calculate_centered_y(y, height, style['size'])
-                    
-                    # QUANTIDADES: CENTER-ALIGNED (repair_line_X_qty)
-                    if '_qty' in field_id.lower():
-                        can.drawCentredString(x + width / 2, text_y, formatted_value)
-                        logging.info(f"✅ CENTERED QTY: {field_id} = '{formatted_value}' at center x={x + width / 2}")
-                    else:
-                        can.drawString(x + 2, text_y, formatted_value)
-                
-                elif field_type == 'hours':
-                    # HORAS SEM DECIMAIS (center-aligned)
-                    formatted_value = _format_hours(value)
-                    style = _get_field_style(field_id)
-                    
-                    # Apply style
-                    font_name = f"{style['font']}-Bold" if style['bold'] else style['font']
-                    font_name = f"{font_name}-Oblique" if style['italic'] and not style['bold'] else font_name
-                    can.setFont(font_name, style['size'])
-                    can.setFillColorRGB(*style['color'])
-                    
-                    text_y = _calculate_centered_y(y, height, style['size'])
-                    # Center-align para horas (como na tabela)
-                    can.drawCentredString(x + width / 2, text_y, formatted_value)
-                
-                else:
-                    # TEXTO SIMPLES COM ESTILO
-                    style = _get_field_style(field_id)
-                    
-                    # Apply style
-                    font_name = f"{style['font']}-Bold" if style['bold'] else style['font']
-                    font_name = f"{font_name}-Oblique" if style['italic'] and not style['bold'] else font_name
-                    can.setFont(font_name, style['size'])
-                    can.setFillColorRGB(*style['color'])
-                    
-                    # Convert to uppercase (except for notes/observations fields)
-                    text_value = str(value)
-                    if 'notes' not in field_id and 'observation' not in field_id:
-                        text_value = text_value.upper()
-                    
-                    # DR NUMBER, RA NUMBER, CONTRACT NUMBER: RIGHT-ALIGNED
-                    field_id_lower = field_id.lower()
-                    if 'dr_number' in field_id_lower or 'ra_number' in field_id_lower or 'contract' in field_id_lower:
-                        text_y = _calculate_centered_y(y, height, style['size'])
-                        can.drawRightString(x + width - 2, text_y, text_value[:50])
-                        logging.info(f"✅✅✅ RIGHT-ALIGNED: {field_id} = '{text_value[:50]}' at x={x + width - 2}, y={text_y}, width={width}")
-                    # Handle multiline text for textarea fields
-                    elif 'description' in field_id or 'notes' in field_id or 'damage' in field_id:
-                        # Multiline text - CADA LINHA CENTRALIZADA VERTICALMENTE
-                        lines = text_value.split('\n')
+                        ))
                         
-                        # Se for apenas 1 linha, centralizar verticalmente
-                        if len(lines) == 1:
-                            text_y = _calculate_centered_y(y, height, style['size'])
-                            can.drawString(x + 2, text_y, lines[0][:int(width / 5)])
-                        else:
-                            # Múltiplas linhas: distribuir uniformemente
-                            line_height = style['size'] + 2
-                            max_lines = int(height / line_height)
-                            lines_to_draw = lines[:max_lines]
-                            
-                            # Calcular espaçamento vertical total
-                            total_text_height = len(lines_to_draw) * line_height
-                            start_y = y + (height - total_text_height) / 2 + total_text_height - line_height
-                            
-                            for i, line in enumerate(lines_to_draw):
-                                if start_y - (i * line_height) > y:
-                                    # Centralizar cada linha verticalmente na sua própria área
-                                    line_y = start_y - (i * line_height) + (line_height - style['size']) / 2
-                                    can.drawString(x + 2, line_y, line[:int(width / 5)])
-                    else:
-                        # Single line text - centralizado verticalmente
-                        text_y = _calculate_centered_y(y, height, style['size'])
-                        can.drawString(x + 2, text_y, text_value[:int(width / 5)])
-            
-            can.save()
-            
-            # Merge overlay com página original
-            packet.seek(0)
-            overlay_pdf = PdfReader(packet)
-            page.merge_page(overlay_pdf.pages[0])
-            output_pdf.add_page(page)
+                        conn.execute("""
+                            INSERT INTO damage_report_mapping_history 
+                            (template_version, field_id, x, y, width, height, page, field_type, mapped_by, mapped_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """, (
+                            template_version,
+                            field_id,
+                            coord.get('x'),
+                            coord.get('y'),
+                            coord.get('width'),
+                            coord.get('height'),
+                            coord.get('page', 1),
+                            field_type,
+                            username,
+                            datetime.now().isoformat()
+                        ))
+                
+                conn.commit()
+                logging.info(f"✅ SAVE: {len(coordinates)} coordenadas guardadas na BD (versão {template_version})")
+            finally:
+                conn.close()
         
-        # 5. Retornar PDF preenchido
-        output_buffer = BytesIO()
-        output_pdf.write(output_buffer)
-        output_buffer.seek(0)
+        _damage_pdf_template_changed()
         
-        logging.info(f"✅ PDF filled successfully:")
-        logging.info(f"   - {len(coordinates)} total mapped fields")
-        logging.info(f"   - {num_pages} page(s) in template")
-        logging.info(f"   - Multi-page support: ACTIVE")
-        return output_buffer.read()
+        # Guardar também em ficheiro JSON (backup) - converter array para objeto para compatibilidade
+        backup_coords = {}
+        for coord in coordinates:
+            field_id = coord.get('field_id')
+            if field_id:
+                # Se já existe field_id, criar chave composta
+                page = coord.get('page', 1)
+                key = f"{field_id}@page{page}" if field_id in backup_coords else field_id
+                backup_coords[key] = coord
+        
+        with open('damage_report_coordinates.json', 'w') as f:
+            json.dump(backup_coords, f, indent=2)
         
+        return {"ok": True, "count": len(coordinates), "version": template_version}
+    except Exception as e:
+        logging.error(f"Error saving coordinates: {e}")
+        return {"ok": False, "error": str(e)}
+
+# Tipos, estilos e formatação dos campos: em damage_report_pdf (também correm nos workers)
+_validate_image_data = damage_report_pdf.validate_image_data
+_validate_table_data = damage_report_pdf.validate_table_data
+_format_currency = damage_report_pdf.format_currency
+_format_date = damage_report_pdf.format_date
+_format_number = damage_report_pdf.format_number
+_format_hours = damage_report_pdf.format_hours
+_get_field_style = damage_report_pdf.get_field_style
+_detect_field_type = damage_report_pdf.detect_field_type
+_calculate_centered_y = damage_report_pdf.calculate_centered_y
+
+# --- Motor de PDFs dos Damage Reports ---
+# O template ativo e as coordenadas ficam compilados em memória (TemplatePlan) até
+# mudarem: o upload de template e a gravação de coordenadas chamam
+# _damage_pdf_template_changed() (NOTIFY para os outros workers); escritas de fora
+# da app apanham-se ao fim de DAMAGE_PDF_PLAN_TTL. Vários DRs de uma vez
+# (generate-pdfs-batch) são gerados num pool de processos.
+DAMAGE_PDF_PLAN_TTL = float(os.getenv("DAMAGE_PDF_PLAN_TTL", "600") or 600)
+DAMAGE_PDF_WORKERS = max(1, int(os.getenv("DAMAGE_PDF_WORKERS", "2") or 2))
+DAMAGE_PDF_BATCH_MAX = 200
+DAMAGE_PDF_CHANNEL = "damage_pdf_template_changed"
+_DAMAGE_PDF_PLAN = None  # (plan, time.monotonic() do carregamento)
+_DAMAGE_PDF_PLAN_LOCK = threading.Lock()
+_DAMAGE_PDF_POOL = None
+_DAMAGE_PDF_STATS = {"rendered": 0, "batch_rendered": 0, "errors": 0, "plan_loads": 0, "render_seconds": 0.0}
+
+def _load_damage_pdf_source():
+    """(template_data, coordenadas) ativos; sem template na BD usa o ficheiro"""
+    with _db_lock:
+        conn = _db_connect()
+        try:
+            if conn.__class__.__module__ == 'psycopg2.extensions':
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT file_data FROM damage_report_templates 
+                    WHERE is_active = 1 
+                    ORDER BY version DESC LIMIT 1
+                """)
+                row = cursor.fetchone()
+                cursor.execute("""
+                    SELECT field_id, x, y, width, height, page 
+                    FROM damage_report_coordinates
+                    ORDER BY field_id
+                """)
+                coordinates = cursor.fetchall()
+                cursor.close()
+            else:
+                row = conn.execute("""
+                    SELECT file_data FROM damage_report_templates 
+                    WHERE is_active = 1 
+                    ORDER BY version DESC LIMIT 1
+                """).fetchone()
+                coordinates = conn.execute("""
+                    SELECT field_id, x, y, width, height, page 
+                    FROM damage_report_coordinates
+                    ORDER BY field_id
+                """).fetchall()
+        finally:
+            conn.close()
+    
+    if not row or not row[0]:
+        # Fallback: usar arquivo físico
+        with open('Damage Report.pdf', 'rb') as f:
+            template_data = f.read()
+    else:
+        # PostgreSQL devolve memoryview
+        template_data = bytes(row[0])
+    return template_data, [tuple(r) for r in coordinates]
+
+def _damage_pdf_plan():
+    """Plan do template ativo (recarrega após invalidação ou TTL; corre fora do event loop)"""
+    global _DAMAGE_PDF_PLAN
+    with _DAMAGE_PDF_PLAN_LOCK:
+        cached = _DAMAGE_PDF_PLAN
+        if cached is not None and time.monotonic() - cached[1] < DAMAGE_PDF_PLAN_TTL:
+            return cached[0]
+        template_data, coordinates = _load_damage_pdf_source()
+        if cached is not None and cached[0].key == damage_report_pdf.plan_key(template_data, coordinates):
+            plan = cached[0]
+        else:
+            plan = damage_report_pdf.TemplatePlan(template_data, coordinates)
+            _DAMAGE_PDF_STATS["plan_loads"] += 1
+            logging.info(f"[DAMAGE-PDF] template {plan.key[:8]}: {len(plan.pages)} página(s), {plan.field_count} campos mapeados")
+        _DAMAGE_PDF_PLAN = (plan, time.monotonic())
+        return plan
+
+def _on_damage_pdf_note(payload: str):
+    global _DAMAGE_PDF_PLAN
+    if payload != _WORKER_ID:
+        _DAMAGE_PDF_PLAN = None
+
+_PG_LISTEN_HANDLERS[DAMAGE_PDF_CHANNEL] = _on_damage_pdf_note
+
+def _damage_pdf_template_changed():
+    """Chamar depois de gravar damage_report_templates/coordinates (este worker + NOTIFY aos outros)"""
+    global _DAMAGE_PDF_PLAN
+    _DAMAGE_PDF_PLAN = None
+    if not (_USE_NEW_DB and USE_POSTGRES):
+        return
+    try:
+        with _db_lock:
+            conn = _db_connect()
+            try:
+                conn.execute("SELECT pg_notify(?, ?)", (DAMAGE_PDF_CHANNEL, _WORKER_ID))
+                conn.commit()
+            finally:
+                conn.close()
+    except Exception as e:
+        logging.warning(f"[DAMAGE-PDF] notify: {e}")
+
+def _get_damage_pdf_pool():
+    global _DAMAGE_PDF_POOL
+    if _DAMAGE_PDF_POOL is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _DAMAGE_PDF_POOL = ProcessPoolExecutor(max_workers=DAMAGE_PDF_WORKERS, mp_context=_process_pool_context())
+    return _DAMAGE_PDF_POOL
+
+def _shutdown_damage_pdf_pool():
+    global _DAMAGE_PDF_POOL
+    pool, _DAMAGE_PDF_POOL = _DAMAGE_PDF_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+atexit.register(_shutdown_damage_pdf_pool)
+
+def _damage_pdf_stats() -> Dict[str, Any]:
+    cached = _DAMAGE_PDF_PLAN
+    rendered = _DAMAGE_PDF_STATS["rendered"]
+    return {
+        **_DAMAGE_PDF_STATS,
+        "render_seconds": round(_DAMAGE_PDF_STATS["render_seconds"], 3),
+        "avg_render_ms": round(_DAMAGE_PDF_STATS["render_seconds"] * 1000 / rendered, 1) if rendered else None,
+        "template": cached[0].key[:8] if cached else None,
+        "plan_age_seconds": round(time.monotonic() - cached[1], 1) if cached else None,
+        "workers": DAMAGE_PDF_WORKERS,
+        "images": damage_report_pdf.image_cache_stats(),
+    }
+
+def _fill_template_pdf_with_data(report_data: dict) -> bytes:
+    """
+    Preenche o template PDF ativo com dados usando coordenadas mapeadas
+    Suporta: texto, imagens, tabelas, assinaturas
+    Retorna PDF preenchido como bytes
+    """
+    try:
+        started = time.perf_counter()
+        pdf_data = damage_report_pdf.render(_damage_pdf_plan(), report_data)
+        _DAMAGE_PDF_STATS["rendered"] += 1
+        _DAMAGE_PDF_STATS["render_seconds"] += time.perf_counter() - started
+        return pdf_data
     except Exception as e:
+        _DAMAGE_PDF_STATS["errors"] += 1
         logging.error(f"Error filling template PDF: {e}")
         # Fallback: retornar template vazio
+        with open('Damage Report.pdf', 'rb') as f:
+            return f.read()
+
+async def _render_damage_pdfs(reports: List[dict]) -> List[Dict[str, Any]]:
+    """Vários PDFs: divididos pelos processos do pool ({"ok", "pdf"|"error"} por report)"""
+    if len(reports) < 2:
+        return [{"ok": True, "pdf": await asyncio.to_thread(_fill_template_pdf_with_data, r)} for r in reports]
+    plan = await asyncio.to_thread(_damage_pdf_plan)
+    chunk = -(-len(reports) // DAMAGE_PDF_WORKERS)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(_get_damage_pdf_pool(), damage_report_pdf.render_batch,
+                                 plan.key, plan.template_data, plan.coordinates, reports[i:i + chunk])
+            for i in range(0, len(reports), chunk)
+        ))
+    except Exception as e:
+        # Pool partido (worker morto, etc.): recriar da próxima vez e gerar aqui
+        logging.error(f"[DAMAGE-PDF] batch pool failed: {type(e).__name__}: {e}")
+        _shutdown_damage_pdf_pool()
+        return [{"ok": True, "pdf": await asyncio.to_thread(_fill_template_pdf_with_data, r)} for r in reports]
+    results = [result for part in parts for result in part]
+    ok = sum(1 for r in results if r["ok"])
+    _DAMAGE_PDF_STATS["batch_rendered"] += ok
+    _DAMAGE_PDF_STATS["errors"] += len(results) - ok
+    logging.info(f"[DAMAGE-PDF] batch: {ok}/{len(results)} PDFs em {time.perf_counter() - started:.2f}s")
+    return results
+
+def _damage_report_pdf_data(report: dict) -> dict:
+    """Linha de damage_reports -> report_data com os IDs do mapeador (para o PDF)"""
+    # Formatar datas para dd-mm-yyyy (remover hora se existir)
+    def format_date(date_str):
+        if not date_str:
+            return ''
         try:
-            with open('Damage Report.pdf', 'rb') as f:
-                return f.read()
+            from datetime import datetime
+            # Se já é objeto datetime
+            if isinstance(date_str, datetime):
+                return date_str.strftime('%d-%m-%Y')
+            # Se é string
+            date_str = str(date_str)
+            # Remove hora se existir (ex: "2025-11-06 00:00:00" → "2025-11-06")
+            # Ou "2025-11-06T00:00:00" → "2025-11-06"
+            date_only = date_str.split(' ')[0].split('T')[0]
+            # Converte de yyyy-mm-dd para dd-mm-yyyy
+            dt = datetime.strptime(date_only, '%Y-%m-%d')
+            return dt.strftime('%d-%m-%Y')
         except:
-            raise
+            return str(date_str)  # Retorna original se falhar
+
+    # Mapear campos da BD para IDs do mapeador (camelCase)
+    report_data = {
+        'dr_number': report.get('dr_number', ''),
+        'ra_number': report.get('ra_number', ''),
+        'contractNumber': report.get('contract_number', ''),
+        'date': format_date(report.get('date', '')),
+        'created_at': format_date(report.get('created_at', '')),
+        'inspection_date': format_date(report.get('date', '')),
+        'clientName': report.get('client_name', ''),
+        'clientEmail': report.get('client_email', ''),
+        'clientPhone': report.get('client_phone', ''),
+        'address': report.get('client_address', ''),
+        'city': report.get('client_city', ''),
+        'postalCode': report.get('client_postal_code', ''),
+        'country': report.get('client_country', ''),
+        'customer_postal': ' / '.join(filter(None, [report.get('client_postal_code', ''), report.get('client_city', '')])),
+        'customer_city': report.get('client_city', ''),
+        'vehiclePlate': report.get('vehicle_plate', ''),
+        'vehicleBrand': report.get('vehicle_brand', ''),
+        'vehicleModel': report.get('vehicle_model', ''),
+        'vehicleBrandModel': ' / '.join(filter(None, [report.get('vehicle_brand', ''), report.get('vehicle_model', '')])),
+        'vehicleColor': report.get('vehicle_color', ''),
+        'vehicleKm': report.get('vehicle_km') or report.get('mileage') or '',
+        'pickupDate': format_date(report.get('pickup_date', '')),
+        'pickup_date': format_date(report.get('pickup_date', '')),
+        'pickupTime': report.get('pickup_time', ''),
+        'pickupLocation': report.get('pickup_location', ''),
+        'returnDate': format_date(report.get('return_date', '')),
+        'return_date': format_date(report.get('return_date', '')),
+        'returnTime': report.get('return_time', ''),
+        'returnLocation': report.get('return_location', ''),
+        # As gravações escrevem fuel_pickup/fuel_return; fuel_level_* e fuel_level são de linhas antigas
+        'fuel_level_pickup': report.get('fuel_pickup') or report.get('fuel_level_pickup') or report.get('fuel_level') or '',
+        'fuel_level_return': report.get('fuel_return') or report.get('fuel_level_return') or report.get('fuel_level') or '',
+        'total_repair_cost': report.get('total_amount', ''),
+        'totalRepairCost': report.get('total_amount', ''),
+        'total_amount': report.get('total_amount', ''),
+        'inspector_name': report.get('issued_by', ''),
+        'issued_by': report.get('issued_by', ''),
+        'inspection_date': format_date(report.get('date', '')),
+        'damage_diagram_data': report.get('damage_diagram_data', ''),
+        'damageDiagramData': report.get('damage_diagram_data', '')
+    }
+
+    # ✅ EXTRAIR DESCRIÇÕES INDIVIDUAIS DOS DANOS (damage_1, damage_2, ...)
+    damages_json = report.get('damage_diagram_data', '')
+    if damages_json:
+        try:
+            damages = json.loads(damages_json)
+            for damage in damages:
+                num = damage.get('number')
+                desc = damage.get('description', '')
+                if num:
+                    report_data[f'damage_{num}'] = desc
+            logging.debug(f"✅ Extraídas {len(damages)} descrições de danos")
+        except:
+            logging.warning("⚠️ Erro ao parsear damage_diagram_data")
+
+    # ✅ EXTRAIR FOTOS INDIVIDUAIS (damagePhoto1, damagePhoto2, ...)
+    images_json = report.get('damage_images', '')
+    if images_json:
+        try:
+            images = json.loads(images_json)
+            for idx, image in enumerate(images):
+                photo_data = image.get('data', '')
+                report_data[f'damagePhoto{idx + 1}'] = photo_data
+                report_data[f'damage_photo_{idx + 1}'] = photo_data
+            logging.debug(f"✅ Extraídas {len(images)} fotos")
+        except:
+            logging.warning("⚠️ Erro ao parsear damage_images")
+
+    # ✅ EXTRAIR ITENS DE REPARAÇÃO (repair_line_1, repair_line_2, ...)
+    repair_json = report.get('repair_items', '')
+    total_calculated = 0.0
+    if repair_json:
+        try:
+            repair_items = json.loads(repair_json)
+            for idx, item in enumerate(repair_items):
+                line_num = idx + 1
+                report_data[f'repair_line_{line_num}'] = item.get('description', '')
+                report_data[f'repair_line_{line_num}_qty'] = str(item.get('quantity', ''))
+                hours_val = item.get('hours', '')
+                report_data[f'repair_line_{line_num}_hours'] = '-' if hours_val == 0 or hours_val == '0' else str(hours_val)
+                report_data[f'repair_line_{line_num}_price'] = str(item.get('price', ''))
+                report_data[f'repair_line_{line_num}_subtotal'] = str(item.get('total', ''))
+                # Somar ao total
+                total_calculated += float(item.get('total', 0))
+            logging.debug(f"✅ Extraídos {len(repair_items)} itens de reparação")
+            logging.debug(f"💰 Total calculado: {total_calculated:.2f} €")
+        except:
+            logging.warning("⚠️ Erro ao parsear repair_items")
+
+    # ✅ SOBRESCREVER total_repair_cost com valor CALCULADO (igual ao preview)
+    if total_calculated > 0:
+        report_data['total_repair_cost'] = f"{total_calculated:.2f}"
+        report_data['totalRepairCost'] = f"{total_calculated:.2f}"
+        report_data['total_amount'] = f"{total_calculated:.2f}"
+        logging.debug(f"✅ Total repair cost SOBRESCRITO: {total_calculated:.2f} €")
+
+    # ✅ ADICIONAR CROQUI COM PINS
+    vehicle_diagram_blob = report.get('vehicle_damage_image')
+    if vehicle_diagram_blob:
+        try:
+            diagram_base64 = base64.b64encode(vehicle_diagram_blob).decode('utf-8')
+            report_data['vehicle_diagram'] = f'data:image/png;base64,{diagram_base64}'
+            logging.debug("✅ Croqui com pins adicionado")
+        except:
+            logging.warning("⚠️ Erro ao converter vehicle_damage_image")
+
+    return report_data
 
 @app.post("/api/damage-reports/validate")
 async def validate_damage_report_data(request: Request):
@@ -26348,7 +26308,7 @@ async def preview_damage_report_pdf(request: Request):
         logging.info(f"💰 Total repair cost: {total_repair_cost} €")
         
         # Usar função de overlay para preencher template
-        pdf_data = _fill_template_pdf_with_data(report_data)
+        pdf_data = await asyncio.to_thread(_fill_template_pdf_with_data, report_data)
         
         import time
         timestamp = int(time.time())
@@ -26527,138 +26487,11 @@ async def generate_and_save_damage_report_pdf(request: Request, dr_number: str):
             finally:
                 conn.close()
         
-        # Formatar datas para dd-mm-yyyy (remover hora se existir)
-        def format_date(date_str):
-            if not date_str:
-                return ''
-            try:
-                from datetime import datetime
-                # Se já é objeto datetime
-                if isinstance(date_str, datetime):
-                    return date_str.strftime('%d-%m-%Y')
-                # Se é string
-                date_str = str(date_str)
-                # Remove hora se existir (ex: "2025-11-06 00:00:00" → "2025-11-06")
-                # Ou "2025-11-06T00:00:00" → "2025-11-06"
-                date_only = date_str.split(' ')[0].split('T')[0]
-                # Converte de yyyy-mm-dd para dd-mm-yyyy
-                dt = datetime.strptime(date_only, '%Y-%m-%d')
-                return dt.strftime('%d-%m-%Y')
-            except:
-                return str(date_str)  # Retorna original se falhar
-        
         # 2. Mapear dados para geração
-        report_data = {
-            'dr_number': report.get('dr_number', ''),
-            'ra_number': report.get('ra_number', ''),
-            'contractNumber': report.get('contract_number', ''),
-            'date': format_date(report.get('date', '')),
-            'created_at': format_date(report.get('created_at', '')),
-            'inspection_date': format_date(report.get('date', '')),
-            'clientName': report.get('client_name', ''),
-            'clientEmail': report.get('client_email', ''),
-            'clientPhone': report.get('client_phone', ''),
-            'address': report.get('client_address', ''),
-            'city': report.get('client_city', ''),
-            'postalCode': report.get('client_postal_code', ''),
-            'country': report.get('client_country', ''),
-            'customer_postal': ' / '.join(filter(None, [report.get('client_postal_code', ''), report.get('client_city', '')])),
-            'customer_city': report.get('client_city', ''),
-            'vehiclePlate': report.get('vehicle_plate', ''),
-            'vehicleBrand': report.get('vehicle_brand', ''),
-            'vehicleModel': report.get('vehicle_model', ''),
-            'vehicleBrandModel': ' / '.join(filter(None, [report.get('vehicle_brand', ''), report.get('vehicle_model', '')])),
-            'vehicleKm': report.get('mileage', ''),
-            'pickupDate': format_date(report.get('pickup_date', '')),
-            'pickup_date': format_date(report.get('pickup_date', '')),
-            'pickupTime': report.get('pickup_time', ''),
-            'pickupLocation': report.get('pickup_location', ''),
-            'returnDate': format_date(report.get('return_date', '')),
-            'return_date': format_date(report.get('return_date', '')),
-            'returnTime': report.get('return_time', ''),
-            'returnLocation': report.get('return_location', ''),
-            'fuel_level_pickup': report.get('fuel_level', ''),
-            'fuel_level_return': report.get('fuel_level', ''),
-            'total_repair_cost': report.get('total_amount', ''),
-            'totalRepairCost': report.get('total_amount', ''),
-            'total_amount': report.get('total_amount', ''),
-            'inspector_name': report.get('issued_by', ''),
-            'issued_by': report.get('issued_by', ''),
-            'inspection_date': format_date(report.get('date', '')),
-            'damage_diagram_data': report.get('damage_diagram_data', ''),
-            'damageDiagramData': report.get('damage_diagram_data', '')
-        }
-        
-        # ✅ EXTRAIR DESCRIÇÕES INDIVIDUAIS DOS DANOS (damage_1, damage_2, ...)
-        import json
-        damages_json = report.get('damage_diagram_data', '')
-        if damages_json:
-            try:
-                damages = json.loads(damages_json)
-                for damage in damages:
-                    num = damage.get('number')
-                    desc = damage.get('description', '')
-                    if num:
-                        report_data[f'damage_{num}'] = desc
-                logging.info(f"✅ Extraídas {len(damages)} descrições de danos")
-            except:
-                logging.warning("⚠️ Erro ao parsear damage_diagram_data")
-        
-        # ✅ EXTRAIR FOTOS INDIVIDUAIS (damagePhoto1, damagePhoto2, ...)
-        images_json = report.get('damage_images', '')
-        if images_json:
-            try:
-                images = json.loads(images_json)
-                for idx, image in enumerate(images):
-                    photo_data = image.get('data', '')
-                    report_data[f'damagePhoto{idx + 1}'] = photo_data
-                    report_data[f'damage_photo_{idx + 1}'] = photo_data
-                logging.info(f"✅ Extraídas {len(images)} fotos")
-            except:
-                logging.warning("⚠️ Erro ao parsear damage_images")
-        
-        # ✅ EXTRAIR ITENS DE REPARAÇÃO (repair_line_1, repair_line_2, ...)
-        repair_json = report.get('repair_items', '')
-        total_calculated = 0.0
-        if repair_json:
-            try:
-                repair_items = json.loads(repair_json)
-                for idx, item in enumerate(repair_items):
-                    line_num = idx + 1
-                    report_data[f'repair_line_{line_num}'] = item.get('description', '')
-                    report_data[f'repair_line_{line_num}_qty'] = str(item.get('quantity', ''))
-                    hours_val = item.get('hours', '')
-                    report_data[f'repair_line_{line_num}_hours'] = '-' if hours_val == 0 or hours_val == '0' else str(hours_val)
-                    report_data[f'repair_line_{line_num}_price'] = str(item.get('price', ''))
-                    report_data[f'repair_line_{line_num}_subtotal'] = str(item.get('total', ''))
-                    # Somar ao total
-                    total_calculated += float(item.get('total', 0))
-                logging.info(f"✅ Extraídos {len(repair_items)} itens de reparação")
-                logging.info(f"💰 Total calculado: {total_calculated:.2f} €")
-            except:
-                logging.warning("⚠️ Erro ao parsear repair_items")
-        
-        # ✅ SOBRESCREVER total_repair_cost com valor CALCULADO (igual ao preview)
-        if total_calculated > 0:
-            report_data['total_repair_cost'] = f"{total_calculated:.2f}"
-            report_data['totalRepairCost'] = f"{total_calculated:.2f}"
-            report_data['total_amount'] = f"{total_calculated:.2f}"
-            logging.info(f"✅ Total repair cost SOBRESCRITO: {total_calculated:.2f} €")
-        
-        # ✅ ADICIONAR CROQUI COM PINS
-        vehicle_diagram_blob = report.get('vehicle_damage_image')
-        if vehicle_diagram_blob:
-            import base64
-            try:
-                diagram_base64 = base64.b64encode(vehicle_diagram_blob).decode('utf-8')
-                report_data['vehicle_diagram'] = f'data:image/png;base64,{diagram_base64}'
-                logging.info("✅ Croqui com pins adicionado")
-            except:
-                logging.warning("⚠️ Erro ao converter vehicle_damage_image")
+        report_data = _damage_report_pdf_data(report)
         
         # 3. Gerar PDF
-        logging.info(f"🔧 Calling _fill_template_pdf_with_data...")
-        pdf_data = _fill_template_pdf_with_data(report_data)
+        pdf_data = await asyncio.to_thread(_fill_template_pdf_with_data, report_data)
         logging.info(f"✅ PDF generated! Size: {len(pdf_data)} bytes")
         
         # 4. SALVAR NA BD
@@ -26708,10 +26541,153 @@ async def generate_and_save_damage_report_pdf(request: Request, dr_number: str):
         logging.error(traceback.format_exc())
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
+def _load_damage_reports(dr_numbers: List[str]) -> Dict[str, dict]:
+    """dr_number -> linha de damage_reports (só os que existem e não estão apagados)"""
+    reports = {}
+    with _db_lock:
+        conn = _db_connect()
+        try:
+            placeholders = ", ".join(["?"] * len(dr_numbers))
+            sql = f"SELECT * FROM damage_reports WHERE dr_number IN ({placeholders}) AND (is_deleted = 0 OR is_deleted IS NULL)"
+            if conn.__class__.__module__ == 'psycopg2.extensions':
+                cursor = conn.cursor()
+                cursor.execute(sql.replace("?", "%s"), tuple(dr_numbers))
+            else:
+                cursor = conn.execute(sql, tuple(dr_numbers))
+            columns = [desc[0] for desc in cursor.description]
+            for row in cursor.fetchall():
+                report = dict(zip(columns, row))
+                reports[report['dr_number']] = report
+        finally:
+            conn.close()
+    return reports
+
+def _save_damage_report_pdfs(items: List[Tuple[bytes, str, str]]):
+    """(pdf_data, filename, dr_number) -> damage_reports.pdf_data, numa transação"""
+    with _db_lock:
+        conn = _db_connect()
+        try:
+            is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
+            placeholder = "%s" if is_postgres else "?"
+            sql = f"""
+                UPDATE damage_reports 
+                SET pdf_data = {placeholder}, 
+                    pdf_filename = {placeholder},
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE dr_number = {placeholder}
+            """
+            if is_postgres:
+                cursor = conn.cursor()
+                cursor.executemany(sql, items)
+                cursor.close()
+            else:
+                conn.executemany(sql, items)
+            conn.commit()
+        finally:
+            conn.close()
+
+@app.post("/api/damage-reports/generate-pdfs-batch")
+async def generate_damage_report_pdfs_batch(request: Request):
+    """
+    Gera os PDFs de vários DRs de uma vez (pool de processos, mesmo template)
+    
+    Body: {"dr_numbers": [...], "save": true, "zip": false}
+    - save: grava cada PDF em damage_reports (como generate-and-save-pdf)
+    - zip: devolve os PDFs num .zip em vez do resumo JSON
+    """
+    require_auth(request)
+    
+    try:
+        data = await request.json()
+        dr_numbers = list(dict.fromkeys(str(n).strip() for n in (data.get('dr_numbers') or []) if str(n).strip()))
+        if not dr_numbers:
+            return JSONResponse({"ok": False, "error": "dr_numbers is required"}, status_code=400)
+        if len(dr_numbers) > DAMAGE_PDF_BATCH_MAX:
+            return JSONResponse({"ok": False, "error": f"Too many reports (max {DAMAGE_PDF_BATCH_MAX})"}, status_code=400)
+        save = bool(data.get('save', True))
+        as_zip = bool(data.get('zip', False))
+        
+        started = time.perf_counter()
+        reports = await _run_db(_load_damage_reports, dr_numbers)
+        found = [n for n in dr_numbers if n in reports]
+        rendered = await _render_damage_pdfs([_damage_report_pdf_data(reports[n]) for n in found])
+        render_seconds = time.perf_counter() - started
+        
+        results = [{"dr_number": n, "ok": False, "error": "Damage Report not found"} for n in dr_numbers if n not in reports]
+        generated = []
+        for dr_number, result in zip(found, rendered):
+            if not result["ok"]:
+                results.append({"dr_number": dr_number, "ok": False, "error": result["error"]})
+                continue
+            filename = f"{dr_number.replace('/', '_').replace(':', '_')}.pdf"
+            generated.append((result["pdf"], filename, dr_number))
+            results.append({"dr_number": dr_number, "ok": True, "filename": filename, "size": len(result["pdf"])})
+        
+        if save and generated:
+            await _run_db(_save_damage_report_pdfs, generated)
+        
+        logging.info(f"✅ Batch PDFs: {len(generated)}/{len(dr_numbers)} DRs em {render_seconds:.2f}s")
+        
+        if as_zip:
+            import zipfile
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+                for pdf_data, filename, _ in generated:
+                    zf.writestr(filename, pdf_data)
+            return Response(
+                content=buffer.getvalue(),
+                media_type="application/zip",
+                headers={"Content-Disposition": 'attachment; filename="damage_reports.zip"'}
+            )
+        
+        return JSONResponse({
+            "ok": True,
+            "results": results,
+            "generated": len(generated),
+            "failed": len(results) - len(generated),
+            "saved": save,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "pdfs_per_second": round(len(generated) / render_seconds, 2) if render_seconds > 0 else None,
+        })
+    
+    except Exception as e:
+        logging.error(f"❌ Error generating PDFs batch: {e}")
+        import traceback
+        logging.error(traceback.format_exc())
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+
 # ============================================================
 # VEHICLE DAMAGE AI DETECTION (FREE - No API costs!)
 # ============================================================
 
+# O modelo corre em processos próprios (carregado uma vez por worker) e os pedidos
+# são agrupados em micro-batches: várias fotos da mesma inspeção, ou de inspeções
+# em simultâneo, partilham uma chamada ao modelo e o event loop nunca bloqueia.
+# Resultados em cache pelo sha256 da imagem.
+DAMAGE_AI_WORKERS = max(1, int(os.getenv("DAMAGE_AI_WORKERS", "1") or 1))
+DAMAGE_AI_MAX_BATCH = max(1, int(os.getenv("DAMAGE_AI_MAX_BATCH", "8") or 8))
+DAMAGE_AI_MAX_WAIT_MS = float(os.getenv("DAMAGE_AI_MAX_WAIT_MS", "25") or 25)
+DAMAGE_AI_MAX_FILES = 24  # por pedido bulk
+_DAMAGE_INFERENCE = None
+
+def _damage_inference():
+    global _DAMAGE_INFERENCE
+    if _DAMAGE_INFERENCE is None:
+        import vehicle_damage_ai
+        _DAMAGE_INFERENCE = vehicle_damage_ai.DamageInferenceService(
+            workers=DAMAGE_AI_WORKERS,
+            max_batch=DAMAGE_AI_MAX_BATCH,
+            max_wait_ms=DAMAGE_AI_MAX_WAIT_MS,
+            mp_context=_process_pool_context(),
+        )
+    return _DAMAGE_INFERENCE
+
+def _shutdown_damage_inference():
+    if _DAMAGE_INFERENCE is not None:
+        _DAMAGE_INFERENCE.shutdown()
+
+atexit.register(_shutdown_damage_inference)
+
 @app.post("/api/vehicle/detect-damage")
 async def detect_vehicle_damage(request: Request, file: UploadFile = File(...)):
     """
@@ -26730,11 +26706,8 @@ async def detect_vehicle_damage(request: Request, file: UploadFile = File(...)):
         # Read image bytes
         image_bytes = await file.read()
         
-        # Import AI module
-        import vehicle_damage_ai
-        
-        # Analyze image (FREE!)
-        result = vehicle_damage_ai.analyze_vehicle_damage(image_bytes)
+        # Analyze image (FREE!) - batched with other requests, off the event loop
+        result = await _damage_inference().analyze(image_bytes)
         
         return JSONResponse(result)
     
@@ -26747,16 +26720,66 @@ async def detect_vehicle_damage(request: Request, file: UploadFile = File(...)):
             "error": str(e)
         }, status_code=500)
 
+@app.post("/api/vehicle/detect-damage/bulk")
+async def detect_vehicle_damage_bulk(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Detect damage on several photos at once (e.g. all photos of an inspection)
+    
+    Returns one result per file, in the same order, plus a summary.
+    """
+    require_auth(request)
+    
+    if len(files) > DAMAGE_AI_MAX_FILES:
+        return JSONResponse({
+            "ok": False,
+            "error": f"Too many files (max {DAMAGE_AI_MAX_FILES})"
+        }, status_code=400)
+    
+    try:
+        started = time.perf_counter()
+        images = [await f.read() for f in files]
+        results = await _damage_inference().analyze_many(images)
+        
+        return JSONResponse({
+            "ok": True,
+            "results": [
+                {"filename": f.filename, **result}
+                for f, result in zip(files, results)
+            ],
+            "analyzed": sum(1 for r in results if r.get("ok")),
+            "damaged": sum(1 for r in results if r.get("has_damage")),
+            "failed": sum(1 for r in results if not r.get("ok")),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+    
+    except Exception as e:
+        logging.error(f"Error detecting damage (bulk): {e}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse({
+            "ok": False,
+            "error": str(e)
+        }, status_code=500)
+
+@app.get("/api/admin/damage-inference-stats")
+async def damage_inference_stats(request: Request):
+    """Fila, cache e latência por batch do serviço de deteção de danos"""
+    require_admin(request)
+    return _no_store_json({"ok": True, "stats": _damage_inference().snapshot()})
+
 @app.on_event("startup")
 async def load_ai_models():
-    """Load AI models at startup"""
+    """Start the AI inference workers at startup (model loads in the workers)"""
     try:
-        import vehicle_damage_ai
-        vehicle_damage_ai.load_damage_detection_model()
-        logging.debug("✅ AI models loaded at startup")
+        _damage_inference().warm_up()
+        logging.debug("✅ AI inference workers starting")
     except Exception as e:
         logging.debug(f"⚠️ Could not load AI models: {e}")
 
+@app.on_event("shutdown")
+async def stop_ai_models():
+    _shutdown_damage_inference()
+
 # ============================================================
 # CHECK-OUT/CHECK-IN PDF MAPPING APIs
 # ============================================================
@@ -27638,6 +27661,7 @@ async def upload_rental_agreement_template(request: Request, file: UploadFile =
                 is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
                 
                 # Obter próxima versão
+                _lock_table_for_update(conn, "rental_agreement_templates")
                 if is_postgres:
                     with conn.cursor() as cur:
                         cur.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM rental_agreement_templates")
@@ -27671,6 +27695,7 @@ async def upload_rental_agreement_template(request: Request, file: UploadFile =
                     """, (version, filename, contents, num_pages, username, datetime.now().isoformat(), 1, notes))
                 
                 conn.commit()
+                _ra_coordinates_changed()
                 
                 logging.info(f"✅ RA Template uploaded: v{version}, {num_pages} páginas")
                 
@@ -28194,6 +28219,7 @@ async def save_rental_agreement_coordinates(request: Request):
                 
                 conn.commit()
                 logging.info(f"✅ SAVE RA: {len(coordinates)} coordenadas guardadas na BD (versão {template_version})")
+                _ra_coordinates_changed()
             finally:
                 conn.close()
         
@@ -29972,7 +29998,7 @@ async def fetch_car_photos(request: Request):
     try:
         import asyncio
         from datetime import datetime, timedelta
-        from carjet_direct import scrape_carjet_direct
+        from carjet_direct import scrape_carjet_direct_async
         import sys
         
         # Locations to search
@@ -30018,8 +30044,8 @@ async def fetch_car_photos(request: Request):
                         # SCRAPING REAL do CarJet
                         print(f"[PHOTOS] Scraping CarJet for {location}, {days} days...", file=sys.stderr, flush=True)
                         
-                        # Use scrape_carjet_direct para obter dados reais
-                        items = scrape_carjet_direct(location, start_dt, end_dt, quick=1)
+                        # Use scrape_carjet_direct_async para obter dados reais
+                        items = await scrape_carjet_direct_async(location, start_dt, end_dt, quick=1)
                         
                         print(f"[PHOTOS] Scraped {len(items)} real items from CarJet", file=sys.stderr, flush=True)
                         
@@ -30092,6 +30118,7 @@ async def fetch_car_photos(request: Request):
         
         print(f"\n✅ Photo import completed: {downloaded} downloaded, {skipped} skipped", file=sys.stderr, flush=True)
         
+        _vehicle_photos_changed()
         return _no_store_json({
             "ok": True,
             "message": f"Found {len(all_photos)} car photos",
@@ -31388,29 +31415,58 @@ async def cron_weekly_report(request: Request):
     
     return JSONResponse({"ok": True, "message": "Weekly report started"})
 
-@app.post("/api/backup/create")
-async def create_backup(request: Request):
-    """Create system backup"""
-    require_auth(request)
-    
+BACKUP_PG_DUMP_TIMEOUT = int(os.getenv("BACKUP_PG_DUMP_TIMEOUT", "1800") or 1800)
+
+def _pg_dump_to_file(job: "background_jobs.Job", db_url: str, out_path: Path):
+    """pg_dump direto para o ficheiro (sem o dump inteiro em memória); cancelável"""
+    import subprocess
+    started = time.monotonic()
+    with open(out_path, "wb") as out:
+        proc = subprocess.Popen(["pg_dump", db_url], stdout=out, stderr=subprocess.PIPE)
+        try:
+            while True:
+                try:
+                    proc.wait(timeout=0.5)
+                    break
+                except subprocess.TimeoutExpired:
+                    if job.cancel_requested:
+                        raise background_jobs.JobCancelled(job.id)
+                    if time.monotonic() - started > BACKUP_PG_DUMP_TIMEOUT:
+                        raise TimeoutError(f"pg_dump timeout ({BACKUP_PG_DUMP_TIMEOUT}s)")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        stderr = proc.stderr.read().decode("utf-8", "replace")
+        proc.stderr.close()
+    if proc.returncode != 0:
+        raise RuntimeError(stderr.strip() or f"pg_dump exit {proc.returncode}")
+
+def _create_backup_archive(job: "background_jobs.Job", data: Dict[str, Any]) -> Dict[str, Any]:
+    """Cria o ZIP do backup (corre numa thread do job; apaga o ZIP parcial se falhar/cancelar)"""
+    import zipfile
+
+    # Create backup directory if not exists
+    backup_dir = Path("backups")
+    backup_dir.mkdir(exist_ok=True)
+
+    # Generate backup filename with timestamp
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    backup_filename = f"backup_{timestamp}.zip"
+    backup_path = backup_dir / backup_filename
+
+    steps = ["database", "uploads", "static", "templates", "code", "config"]
+    job.progress(0, len(steps), "A criar backup...")
+
+    def add_tree(zipf, folder: str):
+        root = Path(folder)
+        if root.exists():
+            for file_path in root.rglob("*"):
+                job.check_cancelled()
+                if file_path.is_file():
+                    zipf.write(file_path, f"{folder}/{file_path.relative_to(root)}")
+
     try:
-        import zipfile
-        import shutil
-        from datetime import datetime
-        
-        data = await request.json()
-        logging.info(f"Backup requested with options: {data}")
-        
-        # Create backup directory if not exists
-        backup_dir = Path("backups")
-        backup_dir.mkdir(exist_ok=True)
-        
-        # Generate backup filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"backup_{timestamp}.zip"
-        backup_path = backup_dir / backup_filename
-        
-        # Create ZIP file
         with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             # 1. All Databases (SQLite local)
             if data.get('database', True):
@@ -31421,84 +31477,51 @@ async def create_backup(request: Request):
                         zipf.write(db_path, f"database/{db_file}")
                         size_kb = db_path.stat().st_size / 1024
                         logging.info(f"✅ Database {db_file} added to backup ({size_kb:.1f} KB)")
-                
+
                 # 1.1. PostgreSQL Backup (if in production)
-                if _USE_NEW_DB and USE_POSTGRES:
+                db_url = os.getenv("DATABASE_URL")
+                if _USE_NEW_DB and USE_POSTGRES and db_url:
+                    pg_backup_file = f"postgres_backup_{timestamp}.sql"
+                    pg_backup_path = backup_dir / pg_backup_file
+                    job.progress(message="🐘 pg_dump...")
+                    logging.info("🐘 Creating PostgreSQL backup...")
                     try:
-                        import subprocess
-                        pg_backup_file = f"postgres_backup_{timestamp}.sql"
-                        pg_backup_path = backup_dir / pg_backup_file
-                        
-                        # Get DATABASE_URL
-                        db_url = os.getenv("DATABASE_URL")
-                        if db_url:
-                            logging.info("🐘 Creating PostgreSQL backup...")
-                            result = subprocess.run(
-                                ["pg_dump", db_url],
-                                capture_output=True,
-                                text=True,
-                                timeout=300  # 5 minutes timeout
-                            )
-                            
-                            if result.returncode == 0:
-                                with open(pg_backup_path, 'w') as f:
-                                    f.write(result.stdout)
-                                
-                                zipf.write(pg_backup_path, f"database/{pg_backup_file}")
-                                size_mb = pg_backup_path.stat().st_size / (1024 * 1024)
-                                logging.info(f"✅ PostgreSQL backup added ({size_mb:.2f} MB)")
-                                
-                                # Remove temp file
-                                pg_backup_path.unlink()
-                            else:
-                                logging.error(f"❌ PostgreSQL backup failed: {result.stderr}")
+                        _pg_dump_to_file(job, db_url, pg_backup_path)
+                        zipf.write(pg_backup_path, f"database/{pg_backup_file}")
+                        size_mb = pg_backup_path.stat().st_size / (1024 * 1024)
+                        logging.info(f"✅ PostgreSQL backup added ({size_mb:.2f} MB)")
+                    except background_jobs.JobCancelled:
+                        raise
                     except Exception as e:
                         logging.error(f"❌ PostgreSQL backup error: {e}")
-            
-            # 2. Settings (localStorage data stored in DB)
-            if data.get('settings', True):
-                # Settings are in localStorage, backed up with database
-                pass
-            
-            # 3. Vehicle mappings (in database)
-            if data.get('vehicles', True):
-                # Vehicle data is in database
-                pass
-            
+                    finally:
+                        pg_backup_path.unlink(missing_ok=True)
+            # Settings e mapeamentos de veículos estão na base de dados
+            job.progress(1, message="Base de dados")
+
             # 4. Uploaded files (logos, profile pictures)
             if data.get('uploads', True):
-                uploads_dir = Path("uploads")
-                if uploads_dir.exists():
-                    for file_path in uploads_dir.rglob("*"):
-                        if file_path.is_file():
-                            arcname = f"uploads/{file_path.relative_to(uploads_dir)}"
-                            zipf.write(file_path, arcname)
-                    logging.info("✅ Uploads added to backup")
-            
+                add_tree(zipf, "uploads")
+                logging.info("✅ Uploads added to backup")
+            job.progress(2, message="Uploads")
+
             # 5. ALL Static files
-            static_dir = Path("static")
-            if static_dir.exists():
-                for file_path in static_dir.rglob("*"):
-                    if file_path.is_file():
-                        arcname = f"static/{file_path.relative_to(static_dir)}"
-                        zipf.write(file_path, arcname)
-                logging.info("✅ All static files added to backup")
-            
+            add_tree(zipf, "static")
+            logging.info("✅ All static files added to backup")
+            job.progress(3, message="Static")
+
             # 6. ALL Templates
-            templates_dir = Path("templates")
-            if templates_dir.exists():
-                for file_path in templates_dir.rglob("*"):
-                    if file_path.is_file():
-                        arcname = f"templates/{file_path.relative_to(templates_dir)}"
-                        zipf.write(file_path, arcname)
-                logging.info("✅ All templates added to backup")
-            
+            add_tree(zipf, "templates")
+            logging.info("✅ All templates added to backup")
+            job.progress(4, message="Templates")
+
             # 7. Main.py and other Python files
             for py_file in Path(".").glob("*.py"):
                 if py_file.is_file():
                     zipf.write(py_file, f"code/{py_file.name}")
             logging.info("✅ Python files added to backup")
-            
+            job.progress(5, message="Código")
+
             # 8. Requirements and config files
             config_files = ["requirements.txt", "Procfile", "runtime.txt", ".gitignore"]
             for config_file in config_files:
@@ -31506,31 +31529,50 @@ async def create_backup(request: Request):
                 if config_path.exists():
                     zipf.write(config_path, f"config/{config_file}")
             logging.info("✅ Config files added to backup")
-            
-            # 6. OAuth settings (if requested - sensitive!)
+
+            # 9. OAuth settings (if requested - sensitive!)
             if data.get('oauth', False):
                 env_path = Path(".env")
                 if env_path.exists():
                     zipf.write(env_path, "config/.env")
                     logging.info("✅ OAuth config added to backup")
-        
-        # Get file size
-        file_size = backup_path.stat().st_size
-        size_mb = file_size / (1024 * 1024)
-        
-        logging.info(f"✅ Backup created: {backup_filename} ({size_mb:.2f} MB)")
-        
-        return JSONResponse({
-            "ok": True,
-            "message": f"Backup criado com sucesso ({size_mb:.2f} MB)",
-            "downloadUrl": f"/api/backup/download/{backup_filename}",
-            "filename": backup_filename,
-            "size": f"{size_mb:.2f} MB"
-        })
-        
-    except Exception as e:
-        logging.error(f"Backup creation error: {str(e)}")
-        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+    except BaseException:
+        backup_path.unlink(missing_ok=True)
+        raise
+
+    # Get file size
+    size_mb = backup_path.stat().st_size / (1024 * 1024)
+    logging.info(f"✅ Backup created: {backup_filename} ({size_mb:.2f} MB)")
+    job.progress(len(steps), message=f"Backup criado ({size_mb:.2f} MB)")
+
+    return {
+        "ok": True,
+        "message": f"Backup criado com sucesso ({size_mb:.2f} MB)",
+        "downloadUrl": f"/api/backup/download/{backup_filename}",
+        "filename": backup_filename,
+        "size": f"{size_mb:.2f} MB"
+    }
+
+@app.post("/api/backup/create")
+async def create_backup(request: Request):
+    """
+    Create system backup
+    Job em background: o result do job tem o downloadUrl (?wait=1 espera e devolve-o)
+    """
+    require_auth(request)
+
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        return JSONResponse({"ok": False, "error": "Invalid backup options"}, status_code=400)
+    logging.info(f"Backup requested with options: {data}")
+
+    async def run(job):
+        return await job.run_in_thread(_create_backup_archive, job, data)
+
+    return await _submit_job(request, "backup", run, params=data, group="backup")
 
 @app.get("/api/backup/download/{filename}")
 async def download_backup(request: Request, filename: str):
@@ -34740,75 +34782,77 @@ async def get_automated_search_history_light(request: Request, months: int = 24,
             if month_key not in month_keys:
                 month_keys.append(month_key)
         
-        with _db_lock:
-            conn = _db_connect()
-            try:
-                is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
-                history = {}
-                
-                location_filter = ""
-                if location:
-                    location_filter = " AND location = %s" if is_postgres else " AND location = ?"
-                
-                if is_postgres:
-                    with conn.cursor() as cur:
+        def _query():
+            with _db_lock:
+                conn = _db_connect()
+                try:
+                    is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
+                    history = {}
+                    
+                    location_filter = ""
+                    if location:
+                        location_filter = " AND location = %s" if is_postgres else " AND location = ?"
+                    
+                    if is_postgres:
+                        with conn.cursor() as cur:
+                            query = f"""
+                                SELECT id, location, search_type, search_date, month_key, price_count, dias
+                                FROM automated_search_history
+                                WHERE month_key = ANY(%s){location_filter}
+                                ORDER BY search_date DESC
+                                LIMIT 1000
+                            """
+                            params = (month_keys, location) if location else (month_keys,)
+                            cur.execute(query, params)
+                            rows = cur.fetchall()
+                    else:
+                        placeholders = ','.join(['?' for _ in month_keys])
                         query = f"""
                             SELECT id, location, search_type, search_date, month_key, price_count, dias
                             FROM automated_search_history
-                            WHERE month_key = ANY(%s){location_filter}
+                            WHERE month_key IN ({placeholders}){location_filter}
                             ORDER BY search_date DESC
                             LIMIT 1000
                         """
-                        params = (month_keys, location) if location else (month_keys,)
-                        cur.execute(query, params)
-                        rows = cur.fetchall()
-                else:
-                    placeholders = ','.join(['?' for _ in month_keys])
-                    query = f"""
-                        SELECT id, location, search_type, search_date, month_key, price_count, dias
-                        FROM automated_search_history
-                        WHERE month_key IN ({placeholders}){location_filter}
-                        ORDER BY search_date DESC
-                        LIMIT 1000
-                    """
-                    params = (*month_keys, location) if location else month_keys
-                    rows = conn.execute(query, params).fetchall()
-                
-                # Group by month_key and search_type
-                for row in rows:
-                    row_id, row_location, search_type, search_date, month_key, price_count, dias_json = row
+                        params = (*month_keys, location) if location else month_keys
+                        rows = conn.execute(query, params).fetchall()
                     
-                    # Parse dias JSON
-                    import json
-                    dias_array = []
-                    if dias_json:
-                        try:
-                            dias_array = json.loads(dias_json) if isinstance(dias_json, str) else dias_json
-                        except:
-                            dias_array = []
+                    # Group by month_key and search_type
+                    for row in rows:
+                        row_id, row_location, search_type, search_date, month_key, price_count, dias_json = row
+                        
+                        # Parse dias JSON
+                        import json
+                        dias_array = []
+                        if dias_json:
+                            try:
+                                dias_array = json.loads(dias_json) if isinstance(dias_json, str) else dias_json
+                            except:
+                                dias_array = []
+                        
+                        if month_key not in history:
+                            history[month_key] = {}
+                        if search_type not in history[month_key]:
+                            history[month_key][search_type] = []
+                        
+                        history[month_key][search_type].append({
+                            'id': row_id,
+                            'location': row_location,
+                            'searchDate': search_date,
+                            'date': search_date,  # Alias for frontend compatibility
+                            'search_type': search_type,  # Add search_type to each entry
+                            'priceCount': price_count,
+                            'dias': dias_array,  # Include dias array
+                            # Note: prices, supplierData will be loaded on-demand
+                        })
                     
-                    if month_key not in history:
-                        history[month_key] = {}
-                    if search_type not in history[month_key]:
-                        history[month_key][search_type] = []
+                    logging.info(f"✅ [HISTORY-LIGHT] Returned {len(rows)} lightweight entries for {len(month_keys)} months")
+                    return JSONResponse({"ok": True, "history": history})
                     
-                    history[month_key][search_type].append({
-                        'id': row_id,
-                        'location': row_location,
-                        'searchDate': search_date,
-                        'date': search_date,  # Alias for frontend compatibility
-                        'search_type': search_type,  # Add search_type to each entry
-                        'priceCount': price_count,
-                        'dias': dias_array,  # Include dias array
-                        # Note: prices, supplierData will be loaded on-demand
-                    })
-                
-                logging.info(f"✅ [HISTORY-LIGHT] Returned {len(rows)} lightweight entries for {len(month_keys)} months")
-                return JSONResponse({"ok": True, "history": history})
-                
-            finally:
-                conn.close()
-                
+                finally:
+                    conn.close()
+        
+        return await _run_db(_query)
     except Exception as e:
         logging.error(f"❌ [HISTORY-LIGHT] Error: {str(e)}")
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
@@ -34823,108 +34867,110 @@ async def get_search_version(version_id: int):
     try:
         logging.info(f"📦 [VERSION-LOAD] Loading full data for version ID: {version_id}")
         
-        with _db_lock:
-            conn = _db_connect()
-            try:
-                is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
-                
-                if is_postgres:
-                    with conn.cursor() as cur:
+        def _query():
+            with _db_lock:
+                conn = _db_connect()
+                try:
+                    is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
+                    
+                    if is_postgres:
+                        with conn.cursor() as cur:
+                            try:
+                                cur.execute("""
+                                    SELECT id, location, search_type, search_date, month_key, 
+                                           prices_data, dias, price_count, supplier_data
+                                    FROM automated_search_history
+                                    WHERE id = %s
+                                """, (version_id,))
+                                row = cur.fetchone()
+                                has_supplier_data = True
+                            except:
+                                conn.rollback()
+                                cur.execute("""
+                                    SELECT id, location, search_type, search_date, month_key, 
+                                           prices_data, dias, price_count
+                                    FROM automated_search_history
+                                    WHERE id = %s
+                                """, (version_id,))
+                                row = cur.fetchone()
+                                has_supplier_data = False
+                    else:
                         try:
-                            cur.execute("""
+                            row = conn.execute("""
                                 SELECT id, location, search_type, search_date, month_key, 
                                        prices_data, dias, price_count, supplier_data
                                 FROM automated_search_history
-                                WHERE id = %s
-                            """, (version_id,))
-                            row = cur.fetchone()
+                                WHERE id = ?
+                            """, (version_id,)).fetchone()
                             has_supplier_data = True
                         except:
-                            conn.rollback()
-                            cur.execute("""
+                            row = conn.execute("""
                                 SELECT id, location, search_type, search_date, month_key, 
                                        prices_data, dias, price_count
                                 FROM automated_search_history
-                                WHERE id = %s
-                            """, (version_id,))
-                            row = cur.fetchone()
+                                WHERE id = ?
+                            """, (version_id,)).fetchone()
                             has_supplier_data = False
-                else:
-                    try:
-                        row = conn.execute("""
-                            SELECT id, location, search_type, search_date, month_key, 
-                                   prices_data, dias, price_count, supplier_data
-                            FROM automated_search_history
-                            WHERE id = ?
-                        """, (version_id,)).fetchone()
-                        has_supplier_data = True
-                    except:
-                        row = conn.execute("""
-                            SELECT id, location, search_type, search_date, month_key, 
-                                   prices_data, dias, price_count
-                            FROM automated_search_history
-                            WHERE id = ?
-                        """, (version_id,)).fetchone()
-                        has_supplier_data = False
-                
-                if not row:
-                    return JSONResponse({"ok": False, "error": "Version not found"}, status_code=404)
-                
-                import json
-                
-                # Helper to parse JSON (handles both PostgreSQL dict and SQLite string)
-                def parse_json(data, default):
-                    if not data:
-                        return default
-                    if isinstance(data, (dict, list)):
-                        return data  # Already parsed (PostgreSQL JSONB)
-                    try:
-                        return json.loads(data)  # Parse string (SQLite)
-                    except:
-                        return default
-                
-                if has_supplier_data:
-                    row_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count, supplier_data = row
-                    
-                    # DEBUG: Log raw supplier_data
-                    logging.info(f"🔍 [VERSION-LOAD] Raw supplier_data type: {type(supplier_data)}")
-                    if supplier_data:
-                        if isinstance(supplier_data, str):
-                            logging.info(f"🔍 [VERSION-LOAD] supplier_data string length: {len(supplier_data)}")
-                            logging.info(f"🔍 [VERSION-LOAD] supplier_data preview: {supplier_data[:200] if len(supplier_data) > 200 else supplier_data}")
-                        elif isinstance(supplier_data, dict):
-                            logging.info(f"🔍 [VERSION-LOAD] supplier_data keys: {list(supplier_data.keys())[:10]}")
-                            logging.info(f"🔍 [VERSION-LOAD] supplier_data size: {len(supplier_data)} keys")
+                    
+                    if not row:
+                        return JSONResponse({"ok": False, "error": "Version not found"}, status_code=404)
+                    
+                    import json
+                    
+                    # Helper to parse JSON (handles both PostgreSQL dict and SQLite string)
+                    def parse_json(data, default):
+                        if not data:
+                            return default
+                        if isinstance(data, (dict, list)):
+                            return data  # Already parsed (PostgreSQL JSONB)
+                        try:
+                            return json.loads(data)  # Parse string (SQLite)
+                        except:
+                            return default
+                    
+                    if has_supplier_data:
+                        row_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count, supplier_data = row
+                        
+                        # DEBUG: Log raw supplier_data
+                        logging.info(f"🔍 [VERSION-LOAD] Raw supplier_data type: {type(supplier_data)}")
+                        if supplier_data:
+                            if isinstance(supplier_data, str):
+                                logging.info(f"🔍 [VERSION-LOAD] supplier_data string length: {len(supplier_data)}")
+                                logging.info(f"🔍 [VERSION-LOAD] supplier_data preview: {supplier_data[:200] if len(supplier_data) > 200 else supplier_data}")
+                            elif isinstance(supplier_data, dict):
+                                logging.info(f"🔍 [VERSION-LOAD] supplier_data keys: {list(supplier_data.keys())[:10]}")
+                                logging.info(f"🔍 [VERSION-LOAD] supplier_data size: {len(supplier_data)} keys")
+                            else:
+                                logging.info(f"🔍 [VERSION-LOAD] supplier_data value: {supplier_data}")
                         else:
-                            logging.info(f"🔍 [VERSION-LOAD] supplier_data value: {supplier_data}")
+                            logging.warning(f"⚠️ [VERSION-LOAD] supplier_data is EMPTY/NULL in database for ID {version_id}")
+                        
+                        supplier_data_parsed = parse_json(supplier_data, {})
+                        logging.info(f"🔍 [VERSION-LOAD] Parsed supplier_data: {len(supplier_data_parsed)} keys")
                     else:
-                        logging.warning(f"⚠️ [VERSION-LOAD] supplier_data is EMPTY/NULL in database for ID {version_id}")
+                        row_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count = row
+                        supplier_data_parsed = {}
+                        logging.warning(f"⚠️ [VERSION-LOAD] No supplier_data column available for ID {version_id}")
                     
-                    supplier_data_parsed = parse_json(supplier_data, {})
-                    logging.info(f"🔍 [VERSION-LOAD] Parsed supplier_data: {len(supplier_data_parsed)} keys")
-                else:
-                    row_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count = row
-                    supplier_data_parsed = {}
-                    logging.warning(f"⚠️ [VERSION-LOAD] No supplier_data column available for ID {version_id}")
-                
-                version_data = {
-                    'id': row_id,
-                    'location': row_location,
-                    'searchType': search_type,
-                    'searchDate': search_date,
-                    'monthKey': month_key,
-                    'prices': parse_json(prices_data, {}),
-                    'dias': parse_json(dias, []),
-                    'priceCount': price_count,
-                    'supplierData': supplier_data_parsed
-                }
-                
-                logging.info(f"✅ [VERSION-LOAD] Loaded version {version_id}: {price_count} prices, supplierData keys: {len(supplier_data_parsed)}")
-                return JSONResponse({"ok": True, "version": version_data})
-                
-            finally:
-                conn.close()
-                
+                    version_data = {
+                        'id': row_id,
+                        'location': row_location,
+                        'searchType': search_type,
+                        'searchDate': search_date,
+                        'monthKey': month_key,
+                        'prices': parse_json(prices_data, {}),
+                        'dias': parse_json(dias, []),
+                        'priceCount': price_count,
+                        'supplierData': supplier_data_parsed
+                    }
+                    
+                    logging.info(f"✅ [VERSION-LOAD] Loaded version {version_id}: {price_count} prices, supplierData keys: {len(supplier_data_parsed)}")
+                    return JSONResponse({"ok": True, "version": version_data})
+                    
+                finally:
+                    conn.close()
+        
+        return await _run_db(_query)
     except Exception as e:
         import traceback
         logging.error(f"❌ [VERSION-LOAD] Error loading version {version_id}: {str(e)}")
@@ -34954,131 +35000,133 @@ async def get_automated_search_history(request: Request, months: int = 6, locati
             if month_key not in month_keys:
                 month_keys.append(month_key)
         
-        with _db_lock:
-            conn = _db_connect()
-            try:
-                is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
-                history = {}
-                
-                # Build WHERE clause for location filter
-                location_filter = ""
-                if location:
-                    location_filter = " AND location = %s" if is_postgres else " AND location = ?"
-                    logging.info(f"📊 [HISTORY-FILTER] Applying SQL filter: location = '{location}'")
-                
-                if is_postgres:
-                    with conn.cursor() as cur:
-                        # Try to get all searches with supplier_data
+        def _query():
+            with _db_lock:
+                conn = _db_connect()
+                try:
+                    is_postgres = conn.__class__.__module__ == 'psycopg2.extensions'
+                    history = {}
+                    
+                    # Build WHERE clause for location filter
+                    location_filter = ""
+                    if location:
+                        location_filter = " AND location = %s" if is_postgres else " AND location = ?"
+                        logging.info(f"📊 [HISTORY-FILTER] Applying SQL filter: location = '{location}'")
+                    
+                    if is_postgres:
+                        with conn.cursor() as cur:
+                            # Try to get all searches with supplier_data
+                            try:
+                                query = f"""
+                                    SELECT id, location, search_type, search_date, month_key, 
+                                           prices_data, dias, price_count, supplier_data
+                                    FROM automated_search_history
+                                    WHERE month_key = ANY(%s){location_filter}
+                                    ORDER BY search_date DESC
+                                    LIMIT 500
+                                """
+                                params = (month_keys, location) if location else (month_keys,)
+                                logging.info(f"📊 [HISTORY-FILTER] PostgreSQL query params: month_keys={len(month_keys)} months, location='{location if location else 'ALL'}'")
+                                cur.execute(query, params)
+                                rows = cur.fetchall()
+                                logging.info(f"📊 [HISTORY-FILTER] Found {len(rows)} total rows from database")
+                                has_supplier_data = True
+                            except Exception as e:
+                                # Column doesn't exist - rollback transaction and use old schema
+                                logging.warning(f"supplier_data column not found, using old schema: {e}")
+                                conn.rollback()
+                                query = f"""
+                                    SELECT id, location, search_type, search_date, month_key, 
+                                           prices_data, dias, price_count
+                                    FROM automated_search_history
+                                    WHERE month_key = ANY(%s){location_filter}
+                                    ORDER BY search_date DESC
+                                    LIMIT 500
+                                """
+                                params = (month_keys, location) if location else (month_keys,)
+                                cur.execute(query, params)
+                                rows = cur.fetchall()
+                                has_supplier_data = False
+                    else:
+                        placeholders = ','.join(['?' for _ in month_keys])
                         try:
                             query = f"""
                                 SELECT id, location, search_type, search_date, month_key, 
                                        prices_data, dias, price_count, supplier_data
                                 FROM automated_search_history
-                                WHERE month_key = ANY(%s){location_filter}
+                                WHERE month_key IN ({placeholders}){location_filter}
                                 ORDER BY search_date DESC
                                 LIMIT 500
                             """
-                            params = (month_keys, location) if location else (month_keys,)
-                            logging.info(f"📊 [HISTORY-FILTER] PostgreSQL query params: month_keys={len(month_keys)} months, location='{location if location else 'ALL'}'")
-                            cur.execute(query, params)
-                            rows = cur.fetchall()
-                            logging.info(f"📊 [HISTORY-FILTER] Found {len(rows)} total rows from database")
+                            params = (*month_keys, location) if location else month_keys
+                            rows = conn.execute(query, params).fetchall()
                             has_supplier_data = True
                         except Exception as e:
-                            # Column doesn't exist - rollback transaction and use old schema
                             logging.warning(f"supplier_data column not found, using old schema: {e}")
                             conn.rollback()
                             query = f"""
                                 SELECT id, location, search_type, search_date, month_key, 
                                        prices_data, dias, price_count
                                 FROM automated_search_history
-                                WHERE month_key = ANY(%s){location_filter}
+                                WHERE month_key IN ({placeholders}){location_filter}
                                 ORDER BY search_date DESC
                                 LIMIT 500
                             """
-                            params = (month_keys, location) if location else (month_keys,)
-                            cur.execute(query, params)
-                            rows = cur.fetchall()
+                            params = (*month_keys, location) if location else month_keys
+                            rows = conn.execute(query, params).fetchall()
                             has_supplier_data = False
-                else:
-                    placeholders = ','.join(['?' for _ in month_keys])
-                    try:
-                        query = f"""
-                            SELECT id, location, search_type, search_date, month_key, 
-                                   prices_data, dias, price_count, supplier_data
-                            FROM automated_search_history
-                            WHERE month_key IN ({placeholders}){location_filter}
-                            ORDER BY search_date DESC
-                            LIMIT 500
-                        """
-                        params = (*month_keys, location) if location else month_keys
-                        rows = conn.execute(query, params).fetchall()
-                        has_supplier_data = True
-                    except Exception as e:
-                        logging.warning(f"supplier_data column not found, using old schema: {e}")
-                        conn.rollback()
-                        query = f"""
-                            SELECT id, location, search_type, search_date, month_key, 
-                                   prices_data, dias, price_count
-                            FROM automated_search_history
-                            WHERE month_key IN ({placeholders}){location_filter}
-                            ORDER BY search_date DESC
-                            LIMIT 500
-                        """
-                        params = (*month_keys, location) if location else month_keys
-                        rows = conn.execute(query, params).fetchall()
-                        has_supplier_data = False
-                
-                # Group by month_key and search_type
-                import json
-                locations_found = set()
-                logging.info(f"📊 [HISTORY-FILTER] Processing {len(rows)} rows for {len(month_keys)} months...")
-                
-                for row in rows:
-                    if has_supplier_data:
-                        search_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count, supplier_data = row
-                    else:
-                        search_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count = row
-                        supplier_data = None
                     
-                    locations_found.add(row_location)
-                    # Removed per-row logging for performance (was logging 100s of times)
+                    # Group by month_key and search_type
+                    import json
+                    locations_found = set()
+                    logging.info(f"📊 [HISTORY-FILTER] Processing {len(rows)} rows for {len(month_keys)} months...")
                     
-                    if month_key not in history:
-                        history[month_key] = {
-                            'current': [],
-                            'automated': []
+                    for row in rows:
+                        if has_supplier_data:
+                            search_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count, supplier_data = row
+                        else:
+                            search_id, row_location, search_type, search_date, month_key, prices_data, dias, price_count = row
+                            supplier_data = None
+                        
+                        locations_found.add(row_location)
+                        # Removed per-row logging for performance (was logging 100s of times)
+                        
+                        if month_key not in history:
+                            history[month_key] = {
+                                'current': [],
+                                'automated': []
+                            }
+                        
+                        entry = {
+                            'id': search_id,
+                            'location': row_location,
+                            'date': search_date,
+                            'timestamp': search_date,  # Same as date for compatibility
+                            'search_type': search_type,  # 'automated' from scheduler or 'current' from manual
+                            'prices': json.loads(prices_data) if isinstance(prices_data, str) else prices_data,
+                            'dias': json.loads(dias) if isinstance(dias, str) else dias,
+                            'priceCount': price_count,
+                            'supplierData': json.loads(supplier_data) if supplier_data and isinstance(supplier_data, str) else (supplier_data if supplier_data else {})
                         }
+                        
+                        history[month_key][search_type].append(entry)
+                        
+                        # NO LIMIT - Keep ALL versions (user requested to save all history)
                     
-                    entry = {
-                        'id': search_id,
-                        'location': row_location,
-                        'date': search_date,
-                        'timestamp': search_date,  # Same as date for compatibility
-                        'search_type': search_type,  # 'automated' from scheduler or 'current' from manual
-                        'prices': json.loads(prices_data) if isinstance(prices_data, str) else prices_data,
-                        'dias': json.loads(dias) if isinstance(dias, str) else dias,
-                        'priceCount': price_count,
-                        'supplierData': json.loads(supplier_data) if supplier_data and isinstance(supplier_data, str) else (supplier_data if supplier_data else {})
-                    }
+                    # Summary logging (not per-row for performance)
+                    total_entries = sum(len(m['automated']) + len(m['current']) for m in history.values())
+                    logging.info(f"📊 [HISTORY] Locations: {list(locations_found)}, Months: {len(history)}, Total entries: {total_entries}")
                     
-                    history[month_key][search_type].append(entry)
+                    return JSONResponse({
+                        "ok": True,
+                        "history": history,
+                        "monthKeys": month_keys
+                    })
                     
-                    # NO LIMIT - Keep ALL versions (user requested to save all history)
-                
-                # Summary logging (not per-row for performance)
-                total_entries = sum(len(m['automated']) + len(m['current']) for m in history.values())
-                logging.info(f"📊 [HISTORY] Locations: {list(locations_found)}, Months: {len(history)}, Total entries: {total_entries}")
-                
-                return JSONResponse({
-                    "ok": True,
-                    "history": history,
-                    "monthKeys": month_keys
-                })
-                
-            finally:
-                conn.close()
-                
+                finally:
+                    conn.close()
+        
+        return await _run_db(_query)
     except Exception as e:
         logging.error(f"❌ Error loading search history: {str(e)}")
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
@@ -0,0 +1,771 @@
+"""
+Extração de campos dos Rental Agreements (PDF) para os Damage Reports
+
+As coordenadas mapeadas em /rental-agreement-mapper ficam compiladas num
+ExtractionPlan (campos agrupados por página) até mudarem. A convenção das
+coordenadas (Y do topo, Y invertido, escala 2x...) é resolvida uma vez por plan,
+no primeiro RA com texto, e não campo a campo em cada upload. Cada página é lida
+uma só vez (get_text("rawdict"): o dict com a bbox de cada caractere) e os campos
+recebem os caracteres cujo centro cai dentro do retângulo.
+
+Sem coordenadas (ou sem nada extraído por elas) continua a extração por padrões
+sobre o texto todo (PyPDF2).
+
+Sem dependências da app: extract_batch corre nos processos do pool de main.py.
+"""
+
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PyPDF2 import PdfReader
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # sem PyMuPDF: só a extração por padrões
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKER_PLANS = 2
+
+# Convenções das coordenadas do mapeador, por ordem de preferência (empate -> a primeira)
+CONVENTIONS = ("DIRETO", "INVERTIDO_Y", "ESCALA_2", "ESCALA_INV")
+
+# Só texto: sem imagens no rawdict (são o grosso do tempo em RAs digitalizados)
+_TEXT_FLAGS = 0
+if fitz is not None:
+    _TEXT_FLAGS = fitz.TEXT_PRESERVE_LIGATURES | fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+
+# Campos do RA -> campos do Damage Report (o frontend espera estes nomes)
+DR_FIELDS = (
+    'contractNumber', 'clientName', 'clientEmail', 'clientPhone', 'address', 'city',
+    'postalCode', 'postalCodeCity', 'country', 'vehiclePlate', 'vehicleBrand', 'vehicleModel',
+    'vehicleBrandModel', 'pickupDate', 'pickupTime', 'pickupLocation', 'pickupFuel',
+    'returnDate', 'returnTime', 'returnLocation', 'returnFuel',
+)
+
+
+# ============================================================
+# Plan
+# ============================================================
+
+class PlanField:
+    __slots__ = ('field_id', 'x', 'y', 'width', 'height')
+
+    def __init__(self, field_id: str, x: float, y: float, width: float, height: float):
+        self.field_id = field_id
+        self.x, self.y, self.width, self.height = x, y, width, height
+
+    def rect(self, convention: str, page_height: float) -> Tuple[float, float, float, float]:
+        """(x0, y0, x1, y1) em coordenadas do PyMuPDF (topo, para baixo)"""
+        x, y, w, h = self.x, self.y, self.width, self.height
+        if convention == "INVERTIDO_Y":
+            return (x, page_height - y - h, x + w, page_height - y)
+        if convention == "ESCALA_2":
+            return (x / 2, y / 2, (x + w) / 2, (y + h) / 2)
+        if convention == "ESCALA_INV":
+            return (x / 2, page_height - y / 2 - h / 2, (x + w) / 2, page_height - y / 2)
+        return (x, y, x + w, y + h)
+
+
+class ExtractionPlan:
+    """
+    Coordenadas compiladas por página
+
+    coordinates: linhas (field_id, x, y, width, height, page) da tabela
+    rental_agreement_coordinates. convention fica None até ser resolvida
+    (ou vem já resolvida de outro processo).
+    """
+
+    def __init__(self, coordinates: Sequence[Sequence], convention: Optional[str] = None):
+        self.coordinates = [tuple(row) for row in coordinates]
+        self.key = plan_key(self.coordinates)
+        self.convention = convention if convention in CONVENTIONS else None
+
+        by_field: "OrderedDict[str, tuple]" = OrderedDict()
+        for field_id, x, y, width, height, page in self.coordinates:
+            by_field[field_id] = (int(page) - 1 if page else 0, float(x), float(y), float(width), float(height))
+
+        # índice da página (0-based) -> campos
+        self.pages: Dict[int, List[PlanField]] = {}
+        for field_id, (page_index, x, y, width, height) in by_field.items():
+            self.pages.setdefault(page_index, []).append(PlanField(field_id, x, y, width, height))
+        self.field_count = len(by_field)
+
+
+def plan_key(coordinates: Sequence[Sequence]) -> str:
+    return hashlib.sha256(repr([tuple(row) for row in coordinates]).encode('utf-8')).hexdigest()[:24]
+
+
+# ============================================================
+# Extração por coordenadas
+# ============================================================
+
+def _page_lines(page) -> List[Tuple[float, float, List[Tuple[float, float, str]]]]:
+    """Uma leitura da página: por linha (y0, y1, [(cx, cy, c), ...])"""
+    lines = []
+    for block in page.get_text("rawdict", flags=_TEXT_FLAGS)["blocks"]:
+        for line in block.get("lines", ()):
+            chars = [
+                ((ch["bbox"][0] + ch["bbox"][2]) / 2, (ch["bbox"][1] + ch["bbox"][3]) / 2, ch["c"])
+                for span in line["spans"] for ch in span["chars"]
+            ]
+            if chars:
+                lines.append((line["bbox"][1], line["bbox"][3], chars))
+    return lines
+
+
+def _text_in(lines, rect) -> str:
+    x0, y0, x1, y1 = rect
+    parts = []
+    for line_y0, line_y1, chars in lines:
+        if line_y1 < y0 or line_y0 > y1:
+            continue
+        text = "".join(c for cx, cy, c in chars if x0 <= cx <= x1 and y0 <= cy <= y1)
+        if text.strip():
+            parts.append(text)
+    return " ".join(" ".join(parts).split())
+
+
+def _ocr_field(page, field: PlanField) -> str:
+    """Página sem camada de texto (RA digitalizado): OCR do retângulo do campo"""
+    try:
+        import pytesseract
+        from PIL import Image
+        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), clip=fitz.Rect(*field.rect("DIRETO", page.rect.height)))
+        img = Image.open(BytesIO(pix.tobytes("png")))
+        return " ".join(pytesseract.image_to_string(img, lang='por+eng', config='--psm 6').split())
+    except Exception as e:
+        logger.debug(f"OCR falhou para {field.field_id}: {e}")
+        return ""
+
+
+def resolve_convention(plan: ExtractionPlan, pages: Dict[int, tuple]) -> Optional[str]:
+    """Convenção que encontra texto em mais campos deste RA (None se nenhuma encontra)"""
+    scores = dict.fromkeys(CONVENTIONS, 0)
+    for page_index, (page, page_height, lines) in pages.items():
+        for convention in CONVENTIONS:
+            scores[convention] += sum(
+                1 for f in plan.pages[page_index] if _text_in(lines, f.rect(convention, page_height))
+            )
+    best = max(CONVENTIONS, key=lambda c: scores[c])  # em empate fica a primeira
+    if not scores[best]:
+        return None
+    logger.info(f"[RA] plan {plan.key[:8]}: coordenadas {best} ({scores[best]}/{plan.field_count} campos com texto)")
+    return best
+
+
+def extract_mapped(plan: ExtractionPlan, pdf_data: bytes) -> Dict[str, str]:
+    """Campos pelas coordenadas do plan ({} se nada extraído)"""
+    fields: Dict[str, str] = {}
+    if fitz is None or not plan.field_count:
+        return fields
+    doc = fitz.open(stream=pdf_data, filetype="pdf")
+    try:
+        # Uma leitura por página com campos (serve também para resolver a convenção)
+        pages = {}
+        for page_index in plan.pages:
+            if page_index < len(doc):
+                page = doc[page_index]
+                pages[page_index] = (page, page.rect.height, _page_lines(page))
+        if plan.convention is None:
+            plan.convention = resolve_convention(plan, pages)
+        convention = plan.convention or "DIRETO"
+        for page_index, (page, page_height, lines) in pages.items():
+            for field in plan.pages[page_index]:
+                text = _text_in(lines, field.rect(convention, page_height)) if lines else _ocr_field(page, field)
+                if text:
+                    fields[field.field_id] = text
+    finally:
+        doc.close()
+    return fields
+
+
+def _country_from_postal_code(postal_code: str) -> Optional[str]:
+    # Portugal: 1000-001, 4000-123
+    if re.match(r'^\d{4}-\d{3}$', postal_code):
+        return 'PORTUGAL' if postal_code[0] in '123456789' else 'ESPANHA'
+    # Espanha: 01234, 28001
+    if re.match(r'^0\d{4}$', postal_code):
+        return 'ESPANHA'
+    # Reino Unido: SW1A 1AA, W1A 0AX
+    if re.match(r'^[A-Z]{1,2}\d{1,2}[A-Z]?\s?\d[A-Z]{2}$', postal_code):
+        return 'UNITED KINGDOM'
+    # USA: 12345, 12345-6789 (apanha também os de 5 dígitos europeus, como antes)
+    if re.match(r'^\d{5}(?:-\d{4})?$', postal_code):
+        return 'USA'
+    # Holanda: 1012 AB, 1012AB
+    if re.match(r'^\d{4}\s?[A-Z]{2}$', postal_code):
+        return 'NETHERLANDS'
+    # Bélgica: 1000, 2000
+    if re.match(r'^[1-9]\d{3}$', postal_code):
+        return 'BELGIUM'
+    # Canadá: K1A 0B1
+    if re.match(r'^[A-Z]\d[A-Z]\s?\d[A-Z]\d$', postal_code):
+        return 'CANADA'
+    return None
+
+
+def _split_combined(fields: Dict[str, str], combined: str, first: str, second: str):
+    value = fields.get(combined, '')
+    if ' / ' in value:
+        parts = value.split(' / ', 1)
+        if not fields.get(first):
+            fields[first] = parts[0].strip()
+        if not fields.get(second):
+            fields[second] = parts[1].strip()
+
+
+def finish_mapped_fields(fields: Dict[str, str]) -> Dict[str, str]:
+    """Campos extraídos por coordenadas -> campos do Damage Report (combinados/divididos, país, matrícula)"""
+    fields = dict(fields)
+    for combined, first, second in (('postalCodeCity', 'postalCode', 'city'),
+                                    ('vehicleBrandModel', 'vehicleBrand', 'vehicleModel')):
+        if fields.get(first) or fields.get(second):
+            joined = ' / '.join(filter(None, [fields.get(first), fields.get(second)]))
+            if joined:
+                fields[combined] = joined
+        elif fields.get(combined):
+            _split_combined(fields, combined, first, second)
+
+    # País pelo código postal
+    postal_code = fields.get('postalCode')
+    if postal_code and not fields.get('country'):
+        country = _country_from_postal_code(postal_code)
+        if country:
+            fields['country'] = country
+            logger.debug(f"País detectado pelo código postal {postal_code}: {country}")
+
+    dr_fields = {name: fields[name] for name in DR_FIELDS if fields.get(name)}
+
+    # "3 0 - X Q - 9 7" -> "30-XQ-97"
+    if 'vehiclePlate' in dr_fields:
+        dr_fields['vehiclePlate'] = dr_fields['vehiclePlate'].replace(' ', '')
+
+    # Contract Number = Rental Agreement Number (ex: 06424-09)
+    if dr_fields.get('contractNumber'):
+        dr_fields['raNumber'] = dr_fields['contractNumber']
+    return dr_fields
+
+
+# ============================================================
+# Extração por padrões (fallback, texto todo)
+# ============================================================
+
+def extract_by_patterns(pdf_data: bytes) -> Dict[str, str]:
+    """Extração INTELIGENTE por PADRÕES (robusta para tamanhos variáveis)"""
+    reader = PdfReader(BytesIO(pdf_data))
+    text = ""
+    for page in reader.pages:
+        text += page.extract_text()
+
+    # Dividir em linhas para análise contextual
+    lines = text.split('\n')
+
+    def clean_spaces(text):
+        """Remove espaços extras entre caracteres"""
+        # Remove espaços entre letras/números individuais
+        # Ex: "3 0 - X Q - 9 7" → "30-XQ-97"
+        cleaned = re.sub(r'(\w)\s+(?=\w)', r'\1', text)
+        # Remove espaços ao redor de hífens
+        cleaned = re.sub(r'\s*-\s*', '-', cleaned)
+        return cleaned
+
+    def extract_country_code(text):
+        """Extrai código do país (ex: DE, PT, ES)"""
+        match = re.search(r'\b([A-Z]{2})\b', text)
+        return match.group(1) if match else text.strip()
+
+    def split_postal_city(text):
+        """Divide código postal e cidade da mesma linha"""
+        # Padrões comuns: "8000-000 FARO", "12345 LISBOA", etc
+        match = re.match(r'([\d-]+)\s+(.+)', text)
+        if match:
+            return match.group(1).strip(), match.group(2).strip()
+        return text, ""
+
+    def extract_email_phone(text):
+        """Extrai email e telefone da mesma linha"""
+        email = ""
+        phone = ""
+
+        email_match = re.search(r'([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})', text, re.IGNORECASE)
+        if email_match:
+            email = email_match.group(1).lower()
+
+        # Telefone: 9 dígitos
+        phone_match = re.search(r'(\d{9})', text)
+        if phone_match:
+            phone = phone_match.group(1)
+
+        return email, phone
+
+    def extract_brand_model(text):
+        """Extrai marca e modelo da mesma linha"""
+        # Ex: "PEUGEOT 308" ou "VOLKSWAGEN GOLF"
+        parts = text.split()
+        if len(parts) >= 2:
+            return parts[0], ' '.join(parts[1:])
+        return text, ""
+
+    def clean_time(text):
+        """Limpa hora removendo números extras"""
+        # Ex: "12 : 009  8  4  1  3" → "12:00"
+        match = re.search(r'(\d{1,2})\s*:\s*(\d{2})', text)
+        if match:
+            return f"{match.group(1)}:{match.group(2)}"
+        return text.strip()
+
+    def extract_time_location(text):
+        """Extrai hora e local da mesma linha (Linha 25)"""
+        # Ex: "12:00 AEROPORTO FARO"
+        match = re.match(r'([\d:]+)\s+(.+)', text)
+        if match:
+            time = clean_time(match.group(1))
+            location = match.group(2).strip()
+            return time, location
+        return "", text
+
+    fields = {}
+
+    # === 1. NÚMERO DO CONTRATO ===
+    # Padrão: XXXXX-VV (5 dígitos, hífen, versão de 2 dígitos)
+    # Exemplo: 00000-09, 12345-01, etc.
+    contract_match = re.search(r'\b(\d{5}-\d{2})\b', text)
+    if contract_match:
+        fields['contractNumber'] = contract_match.group(1)
+        logger.debug(f"   📝 Contrato: {fields['contractNumber']}")
+
+    # === 2. EMAIL ===
+    # Padrão universal de email
+    email_match = re.search(r'\b([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})\b', text, re.IGNORECASE)
+    if email_match:
+        fields['clientEmail'] = email_match.group(1).lower()
+        logger.debug(f"   📧 Email: {fields['clientEmail']}")
+
+    # === 3. TELEFONE ===
+    # Padrão: Com ou sem indicativo internacional
+    # Exemplos: +351 912345678, 912345678, +34 600123456
+    phone_patterns = [
+        r'\+(\d{1,4})\s*(\d{9})',  # Com indicativo: +351 912345678
+        r'(\d{9})\s+[A-Z0-9._%+-]+@',  # Antes do email
+        r'(?<!\d)(\d{9})(?!\d)',  # 9 dígitos isolados
+    ]
+    for i, pattern in enumerate(phone_patterns):
+        phone_match = re.search(pattern, text)
+        if phone_match:
+            if i == 0:  # Com indicativo
+                country_code = phone_match.group(1)
+                phone_number = phone_match.group(2)
+                fields['clientPhone'] = f"+{country_code} {phone_number}"
+                logger.debug(f"   📞 Telefone: {fields['clientPhone']}")
+                break
+            else:
+                # Sem indicativo
+                phone = phone_match.group(1)
+                # Validar que não é NIF (geralmente começa com 1,2,3,5,6,8)
+                if not (phone.startswith(('1', '2', '3', '5', '6', '8')) and len(phone) == 9):
+                    fields['clientPhone'] = phone
+                    logger.debug(f"   📞 Telefone: {phone}")
+                    break
+
+    # === 4. NOME DO CLIENTE ===
+    # Estratégia: linha APÓS o contrato e ANTES do país
+    # Geralmente é uma linha com APENAS LETRAS MAIÚSCULAS
+    if contract_match:
+        contract_pos = text.find(contract_match.group(1))
+        text_after_contract = text[contract_pos + len(contract_match.group(1)):]
+
+        # Procurar primeira linha que seja APENAS letras maiúsculas e espaços (2-50 chars)
+        name_match = re.search(r'\n\s*([A-ZÁÉÍÓÚÂÊÔÃÕÇ\s]{3,50}?)\s*\n', text_after_contract)
+        if name_match:
+            name = name_match.group(1).strip()
+            # Validar que não tem números
+            if not re.search(r'\d', name) and len(name.split()) >= 2:
+                fields['clientName'] = name
+                logger.debug(f"   👤 Nome: {name}")
+
+    # === 5. PAÍS ===
+    # Código de 2 letras isolado (DE, PT, ES, FR, etc.)
+    # Lista expandida de códigos ISO 3166-1 alpha-2
+    country_match = re.search(r'\b([A-Z]{2})\b', text)
+    if country_match:
+        country_code = country_match.group(1)
+        # Validar que é código de país conhecido (ISO 3166-1 alpha-2)
+        known_countries = [
+            # Europa
+            'PT', 'ES', 'FR', 'DE', 'IT', 'UK', 'GB', 'NL', 'BE', 'CH', 'AT', 'IE', 'PL',
+            'SE', 'NO', 'DK', 'FI', 'GR', 'CZ', 'HU', 'RO', 'BG', 'SK', 'HR', 'SI', 'LT',
+            'LV', 'EE', 'LU', 'MT', 'CY', 'IS', 'LI', 'MC', 'AD', 'SM', 'VA',
+            # América
+            'US', 'CA', 'MX', 'BR', 'AR', 'CL', 'CO', 'PE', 'VE', 'EC', 'UY', 'PY', 'BO',
+            # Ásia
+            'CN', 'JP', 'IN', 'KR', 'TH', 'MY', 'SG', 'ID', 'PH', 'VN', 'TR', 'IL', 'AE',
+            'SA', 'QA', 'KW', 'BH', 'OM', 'JO', 'LB',
+            # Oceania
+            'AU', 'NZ',
+            # África
+            'ZA', 'EG', 'MA', 'TN', 'DZ', 'NG', 'KE', 'GH',
+        ]
+        if country_code in known_countries:
+            fields['country'] = country_code
+            logger.debug(f"   🌍 País: {country_code}")
+
+    # === 6. CÓDIGO POSTAL E CIDADE ===
+    # Detectar por padrões de código postal MUNDIAL
+    postal_patterns = [
+        # Portugal: 8000-000, 1000-001
+        (r'\b(\d{4}-\d{3})\b', 'PORTUGAL'),
+        # Espanha: 28001, 08001
+        (r'\b([0-5]\d{4})\b', 'SPAIN'),
+        # Reino Unido: SW1A 1AA, M1 1AE, B33 8TH
+        (r'\b([A-Z]{1,2}\d{1,2}[A-Z]?\s?\d[A-Z]{2})\b', 'UK'),
+        # Estados Unidos: 12345, 12345-6789
+        (r'\b(\d{5}(?:-\d{4})?)\b', 'USA'),
+        # França: 75001, 13008
+        (r'\b([0-9]{5})\b', 'FRANCE'),
+        # Alemanha: 10115, 80331
+        (r'\b([0-9]{5})\b', 'GERMANY'),
+        # Itália: 00100, 20100
+        (r'\b([0-9]{5})\b', 'ITALY'),
+        # Holanda: 1012 AB, 1012AB
+        (r'\b(\d{4}\s?[A-Z]{2})\b', 'NETHERLANDS'),
+        # Bélgica: 1000, 2000
+        (r'\b([1-9]\d{3})\b', 'BELGIUM'),
+        # Suíça: 8001, 1200
+        (r'\b([1-9]\d{3})\b', 'SWITZERLAND'),
+        # Canadá: K1A 0B1, H2X 1Y7
+        (r'\b([A-Z]\d[A-Z]\s?\d[A-Z]\d)\b', 'CANADA'),
+        # Irlanda: D02 AF30, A65 F4E2
+        (r'\b([A-Z]\d{2}\s?[A-Z0-9]{4})\b', 'IRELAND'),
+        # Polónia: 00-950, 31-002
+        (r'\b(\d{2}-\d{3})\b', 'POLAND'),
+        # Áustria: 1010, 5020
+        (r'\b([1-9]\d{3})\b', 'AUSTRIA'),
+        # Grécia: 104 32, 546 21
+        (r'\b(\d{3}\s?\d{2})\b', 'GREECE'),
+    ]
+
+    for pattern, country_hint in postal_patterns:
+        postal_match = re.search(pattern, text)
+        if postal_match:
+            postal_code = postal_match.group(1)
+            fields['postalCode'] = postal_code
+            logger.debug(f"   📮 Código Postal: {postal_code}")
+
+            # Procurar cidade ANTES do código postal (mesma linha)
+            # MELHORADO: Procura texto em MAIÚSCULAS antes do código postal
+            # Evita pegar números (XXXXX) ou texto aleatório
+            city_pattern = r'([A-ZÁÉÍÓÚÂÊÔÃÕÇÖÄÜSS][A-ZÁÉÍÓÚÂÊÔÃÕÇÖÄÜß\s-]{2,40}?)\s+' + re.escape(postal_code)
+            city_match = re.search(city_pattern, text)
+            if city_match:
+                city = city_match.group(1).strip()
+                # Validar que não é só números ou X's
+                if not re.match(r'^[X0-9\s/-]+$', city):
+                    fields['city'] = city
+                    logger.debug(f"   🏙️  Cidade: {city}")
+
+            # Se não encontrou país ainda, usar hint
+            if not fields.get('country'):
+                fields['country'] = country_hint
+            break
+
+    # === 7. MORADA ===
+    # Procurar por palavras-chave MULTI-IDIOMA
+    address_keywords = [
+        # Português
+        'RUA', 'AVENIDA', 'TRAVESSA', 'LARGO', 'PRAÇA', 'URBANIZAÇÃO', 'ESTRADA',
+        # Alemão
+        'STRAßE', 'STRASSE', 'WEG', 'PLATZ', 'ALLEE', 'GASSE',
+        # Espanhol
+        'CALLE', 'AVENIDA', 'PLAZA', 'CAMINO',
+        # Inglês
+        'STREET', 'AVENUE', 'ROAD', 'LANE', 'DRIVE', 'BOULEVARD',
+        # Francês
+        'RUE', 'AVENUE', 'BOULEVARD', 'PLACE', 'CHEMIN',
+        # Italiano
+        'VIA', 'VIALE', 'CORSO', 'PIAZZA', 'STRADA',
+    ]
+    for keyword in address_keywords:
+        address_match = re.search(rf'\b({keyword}[^\n]{{1,80}})', text, re.IGNORECASE)
+        if address_match:
+            addr = address_match.group(1).strip()
+            # Limitar tamanho e remover excesso
+            if len(addr) < 100:
+                fields['address'] = addr
+                logger.debug(f"   🏠 Morada: {addr}")
+                break
+
+    # === 8. MATRÍCULA ===
+    # Padrão português: XX-XX-XX (com ou sem espaços)
+    plate_patterns = [
+        r'([A-Z]{1,2}\s*-\s*\d{2}\s*-\s*[A-Z]{2})',  # Com espaços
+        r'([0-9]{2}\s*-\s*[A-Z]{2}\s*-\s*[0-9]{2})',  # Novo formato
+    ]
+    for pattern in plate_patterns:
+        plate_match = re.search(pattern, text)
+        if plate_match:
+            plate = clean_spaces(plate_match.group(1))
+            fields['vehiclePlate'] = plate
+            logger.debug(f"   🚗 Matrícula: {plate}")
+            break
+
+    # === 9. MARCA E MODELO DO VEÍCULO ===
+    # Procurar marcas conhecidas seguidas de modelo
+    known_brands = ['PEUGEOT', 'RENAULT', 'CITROEN', 'VOLKSWAGEN', 'VW', 'FORD', 'OPEL',
+                   'SEAT', 'FIAT', 'TOYOTA', 'NISSAN', 'HYUNDAI', 'KIA', 'BMW', 'MERCEDES',
+                   'AUDI', 'SKODA', 'MAZDA', 'HONDA', 'SUZUKI', 'DACIA', 'VOLVO']
+
+    for brand in known_brands:
+        brand_pattern = rf'\b({brand})\s+([A-Z0-9\s.]+?)(?=\s*\n|$)'
+        brand_match = re.search(brand_pattern, text)
+        if brand_match:
+            fields['vehicleBrand'] = brand_match.group(1)
+            fields['vehicleModel'] = brand_match.group(2).strip()
+            logger.debug(f"   🏭 Marca: {fields['vehicleBrand']}")
+            logger.debug(f"   🚙 Modelo: {fields['vehicleModel']}")
+            break
+
+    # === 10. DATAS E HORAS POR CONTEXTO ===
+    # NOVA ABORDAGEM: Usar palavras-chave para encontrar datas e horas corretas
+    current_year = datetime.now().year
+
+    # Palavras-chave para identificar seções de Entrega (Pickup) e Recolha (Dropoff)
+    pickup_keywords = ['ENTREGA', 'PICKUP', 'LEVANTAMENTO', 'SALIDA', 'DEPARTURE', 'ABHOL']
+    dropoff_keywords = ['RECOLHA', 'DROPOFF', 'DEVOLUÇÃO', 'DEVOLUCION', 'RETURN', 'RÜCKGABE']
+
+    # Procurar por contexto de ENTREGA/LEVANTAMENTO
+    pickup_context = None
+    for keyword in pickup_keywords:
+        match = re.search(rf'{keyword}', text, re.IGNORECASE)
+        if match:
+            pickup_context = match.start()
+            logger.debug(f"   ✅ Contexto Levantamento encontrado: {keyword}")
+            break
+
+    # Procurar por contexto de RECOLHA/DEVOLUÇÃO
+    dropoff_context = None
+    for keyword in dropoff_keywords:
+        match = re.search(rf'{keyword}', text, re.IGNORECASE)
+        if match:
+            dropoff_context = match.start()
+            logger.debug(f"   ✅ Contexto Devolução encontrado: {keyword}")
+            break
+
+    # Padrões de data
+    date_pattern = r'(\d{2}\s*[/-]\s*\d{2}\s*[/-]\s*\d{4})'
+    time_pattern = r'(\d{1,2}\s*:\s*\d{2})'
+
+    # === LEVANTAMENTO (PICKUP) ===
+    if pickup_context is not None:
+        # Procurar data APÓS a palavra-chave de pickup (próximos 200 caracteres)
+        pickup_section = text[pickup_context:pickup_context + 300]
+
+        # Data
+        date_match = re.search(date_pattern, pickup_section)
+        if date_match:
+            date_clean = re.sub(r'\s+', '', date_match.group(1)).replace('/', '-')
+            try:
+                day, month, year = map(int, date_clean.split('-'))
+                if current_year - 1 <= year <= current_year + 2:
+                    fields['pickupDate'] = date_clean
+                    logger.debug(f"   📅 Data Levantamento: {date_clean}")
+            except:
+                pass
+
+        # Hora (logo após a data)
+        time_match = re.search(time_pattern, pickup_section)
+        if time_match:
+            fields['pickupTime'] = clean_time(time_match.group(1))
+            logger.debug(f"   🕐 Hora Levantamento: {fields['pickupTime']}")
+
+        # Local (MAIÚSCULAS próximo da palavra-chave, antes da data)
+        location_match = re.search(r'\b([A-ZÄÖÜ][A-ZÄÖÜÁÉÍÓÚÂÊÔÃÕÇ\s]{5,50}?)\s+\d{2}\s*[/-]', pickup_section)
+        if location_match:
+            location = location_match.group(1).strip()
+            words = location.split()
+            has_business_keyword = re.search(r'AEROPORTO|AIRPORT|FLUGHAFEN|AUTO|RENT|STATION|PRUDENTE|CAR|CARS|HIRE', location, re.IGNORECASE)
+
+            # VALIDAÇÕES:
+            # 1. Rejeitar se parece código/data (ex: "DE 16", "PT 20")
+            is_code_like = bool(re.match(r'^[A-Z]{2}\s+\d+$', location))
+            # 2. Rejeitar se só tem sigla + número (menos de 6 chars)
+            is_too_short = len(location.replace(' ', '')) < 6
+            # 3. Rejeitar se for exatamente 2 palavras simples SEM palavra-chave
+            is_person_name = (len(words) == 2 and not has_business_keyword)
+
+            if not (is_code_like or is_too_short or is_person_name):
+                fields['pickupLocation'] = location
+                logger.debug(f"   📍 Local Levantamento: {location}")
+            else:
+                reason = "código/sigla" if is_code_like else "muito curto" if is_too_short else "provável nome"
+                logger.debug(f"   ⚠️  Local rejeitado ({reason}): {location}")
+
+    # === DEVOLUÇÃO (DROPOFF) ===
+    if dropoff_context is not None:
+        # Procurar data APÓS a palavra-chave de dropoff (próximos 200 caracteres)
+        dropoff_section = text[dropoff_context:dropoff_context + 300]
+
+        # Data
+        date_match = re.search(date_pattern, dropoff_section)
+        if date_match:
+            date_clean = re.sub(r'\s+', '', date_match.group(1)).replace('/', '-')
+            try:
+                day, month, year = map(int, date_clean.split('-'))
+                if current_year - 1 <= year <= current_year + 2:
+                    fields['dropoffDate'] = date_clean
+                    logger.debug(f"   📅 Data Devolução: {date_clean}")
+            except:
+                pass
+
+        # Hora (logo após a data)
+        time_match = re.search(time_pattern, dropoff_section)
+        if time_match:
+            fields['dropoffTime'] = clean_time(time_match.group(1))
+            logger.debug(f"   🕐 Hora Devolução: {fields['dropoffTime']}")
+
+        # Local (MAIÚSCULAS próximo da palavra-chave, antes da data)
+        location_match = re.search(r'\b([A-ZÄÖÜ][A-ZÄÖÜÁÉÍÓÚÂÊÔÃÕÇ\s]{5,50}?)\s+\d{2}\s*[/-]', dropoff_section)
+        if location_match:
+            location = location_match.group(1).strip()
+            words = location.split()
+            has_business_keyword = re.search(r'AEROPORTO|AIRPORT|FLUGHAFEN|AUTO|RENT|STATION|PRUDENTE|CAR|CARS|HIRE', location, re.IGNORECASE)
+
+            # VALIDAÇÕES:
+            # 1. Rejeitar se parece código/data (ex: "DE 16", "PT 20")
+            is_code_like = bool(re.match(r'^[A-Z]{2}\s+\d+$', location))
+            # 2. Rejeitar se só tem sigla + número (menos de 6 chars)
+            is_too_short = len(location.replace(' ', '')) < 6
+            # 3. Rejeitar se for exatamente 2 palavras simples SEM palavra-chave
+            is_person_name = (len(words) == 2 and not has_business_keyword)
+
+            if not (is_code_like or is_too_short or is_person_name):
+                fields['dropoffLocation'] = location
+                logger.debug(f"   📍 Local Devolução: {location}")
+            else:
+                reason = "código/sigla" if is_code_like else "muito curto" if is_too_short else "provável nome"
+                logger.debug(f"   ⚠️  Local rejeitado ({reason}): {location}")
+
+    # === 12. FALLBACK PARA LOCAIS ===
+    # Se não foram encontrados locais por contexto, tentar método antigo
+    if not fields.get('pickupLocation') or not fields.get('dropoffLocation'):
+        locations_found = []
+        for i, line in enumerate(lines):
+            # Se linha tem data, a linha anterior pode ser local
+            if re.search(r'\d{2}\s*[/-]\s*\d{2}\s*[/-]\s*\d{4}', line):
+                if i > 0:
+                    prev_line = lines[i-1].strip()
+                    # Remover horas do início
+                    prev_line = re.sub(r'^\d{1,2}\s*:\s*\d{2}\s*', '', prev_line)
+                    # Se é maiúsculas e tem tamanho razoável e não é nome de pessoa
+                    if prev_line.isupper() and 5 <= len(prev_line) <= 50:
+                        words = prev_line.split()
+                        has_business_keyword = re.search(r'AEROPORTO|AIRPORT|AUTO|RENT|STATION|PRUDENTE|CAR|CARS|HIRE', prev_line, re.IGNORECASE)
+
+                        # VALIDAÇÕES:
+                        is_code_like = bool(re.match(r'^[A-Z]{2}\s+\d+', prev_line))
+                        is_too_short = len(prev_line.replace(' ', '')) < 6
+                        is_person_name = (len(words) == 2 and not has_business_keyword)
+
+                        # ACEITA se NÃO for código, muito curto ou nome de pessoa
+                        if not (is_code_like or is_too_short or is_person_name):
+                            locations_found.append(prev_line)
+
+        if len(locations_found) >= 2:
+            if not fields.get('pickupLocation'):
+                fields['pickupLocation'] = locations_found[0]
+                logger.debug(f"   📍 Local Levantamento (fallback): {locations_found[0]}")
+            if not fields.get('dropoffLocation'):
+                fields['dropoffLocation'] = locations_found[1]
+                logger.debug(f"   📍 Local Devolução (fallback): {locations_found[1]}")
+        elif len(locations_found) == 1:
+            # Mesmo local
+            if not fields.get('pickupLocation'):
+                fields['pickupLocation'] = locations_found[0]
+            if not fields.get('dropoffLocation'):
+                fields['dropoffLocation'] = locations_found[0]
+            logger.debug(f"   📍 Local (ambos, fallback): {locations_found[0]}")
+
+    # COMBINAR CAMPOS para Damage Report
+    # Código Postal / Cidade
+    if fields.get('postalCode') or fields.get('city'):
+        postal_code_city = ' / '.join(filter(None, [fields.get('postalCode'), fields.get('city')]))
+        if postal_code_city:
+            fields['postalCodeCity'] = postal_code_city
+
+    # Marca / Modelo
+    if fields.get('vehicleBrand') or fields.get('vehicleModel'):
+        brand_model = ' / '.join(filter(None, [fields.get('vehicleBrand'), fields.get('vehicleModel')]))
+        if brand_model:
+            fields['vehicleBrandModel'] = brand_model
+
+    # ✅ COPIAR CONTRACT NUMBER PARA RA NUMBER (são o mesmo campo!)
+    # Contract Number = Rental Agreement Number = ex: 06424-09
+    if 'contractNumber' in fields and fields['contractNumber']:
+        fields['raNumber'] = fields['contractNumber']
+        logger.debug(f"   ✅ RA Number = Contract Number: {fields['raNumber']}")
+
+    # Log para debug
+    logger.debug("✅ === CAMPOS EXTRAÍDOS (PATTERN-BASED) ===")
+    for key, value in fields.items():
+        logger.debug(f"   {key}: {value}")
+    return fields
+
+
+# ============================================================
+# Entrada
+# ============================================================
+
+def extract(plan: Optional[ExtractionPlan], pdf_data: bytes) -> Dict[str, Any]:
+    """
+    Um RA: coordenadas mapeadas primeiro, padrões se não houver (ou nada sair delas)
+    Devolve {"ok": True, "fields": {...}, "method": "mapped_coordinates" | "pattern_based"}
+    """
+    if plan is not None and plan.field_count:
+        try:
+            fields = extract_mapped(plan, pdf_data)
+            if fields:
+                return {"ok": True, "fields": finish_mapped_fields(fields), "method": "mapped_coordinates"}
+        except Exception as e:
+            logger.error(f"Erro ao extrair usando coordenadas: {e}")
+    return {"ok": True, "fields": extract_by_patterns(pdf_data), "method": "pattern_based"}
+
+
+# ============================================================
+# Batch (processos do pool)
+# ============================================================
+
+_WORKER_PLANS: "OrderedDict[str, ExtractionPlan]" = OrderedDict()
+
+
+def _worker_plan(key: str, coordinates, convention: Optional[str]) -> ExtractionPlan:
+    plan = _WORKER_PLANS.get(key)
+    if plan is None:
+        plan = ExtractionPlan(coordinates, convention)
+        _WORKER_PLANS[key] = plan
+        while len(_WORKER_PLANS) > MAX_WORKER_PLANS:
+            _WORKER_PLANS.popitem(last=False)
+    elif plan.convention is None and convention in CONVENTIONS:
+        plan.convention = convention
+    return plan
+
+
+def extract_batch(key: str, coordinates, convention: Optional[str], pdfs: List[bytes]) -> Dict[str, Any]:
+    """
+    Corre num worker: vários RAs com as mesmas coordenadas
+    Devolve {"convention": ..., "results": [{"ok", "fields", "method"} | {"ok": False, "error"}, ...]}
+    """
+    plan = _worker_plan(key, coordinates, convention)
+    results = []
+    for pdf_data in pdfs:
+        try:
+            results.append(extract(plan, pdf_data))
+        except Exception as e:
+            logger.error(f"Error extracting RA fields: {e}")
+            results.append({"ok": False, "error": str(e)})
+    return {"convention": plan.convention, "results": results}
@@ -1969,41 +1969,44 @@ async function startAIAnalysis() {
     resultsDiv.classList.add('hidden');
     progressDiv.classList.remove('hidden');
     
-    let analyzed = 0;
-    const total = Object.keys(inspectionData.photos).length;
-    
-    for (const [photoType, photoBlob] of Object.entries(inspectionData.photos)) {
-        try {
-            // Create form data
-            const formData = new FormData();
-            formData.append('file', photoBlob, `${photoType}.jpg`);
-            
-            // Call AI API
-            const response = await fetch('/api/vehicle/detect-damage', {
-                method: 'POST',
-                body: formData
-            });
-            
-            const result = await response.json();
+    const entries = Object.entries(inspectionData.photos);
+    
+    try {
+        // All photos in one request: the server analyzes them as one batch
+        const formData = new FormData();
+        for (const [photoType, photoBlob] of entries) {
+            formData.append('files', photoBlob, `${photoType}.jpg`);
+        }
+        
+        // Call AI API
+        const response = await fetch('/api/vehicle/detect-damage/bulk', {
+            method: 'POST',
+            body: formData
+        });
+        
+        const data = await response.json();
+        if (!data.ok) throw new Error(data.error || `HTTP ${response.status}`);
+        
+        entries.forEach(([photoType], i) => {
+            const result = data.results[i] || {ok: false, error: 'No result'};
             
             // Store result
             inspectionData.aiResults[photoType] = result;
             
-            // Update progress
-            analyzed++;
-            const percent = Math.round((analyzed / total) * 100);
-            document.getElementById('analysisPercent').textContent = `${percent}%`;
-            document.getElementById('analysisBar').style.width = `${percent}%`;
-            
             // Add result to display
             addAnalysisResult(photoType, result);
-            
-        } catch (error) {
-            console.error(`Error analyzing ${photoType}:`, error);
+        });
+    } catch (error) {
+        console.error('Error analyzing photos:', error);
+        for (const [photoType] of entries) {
             inspectionData.aiResults[photoType] = {ok: false, error: error.message};
         }
     }
     
+    // Update progress
+    document.getElementById('analysisPercent').textContent = '100%';
+    document.getElementById('analysisBar').style.width = '100%';
+    
     // Hide progress, show results
     progressDiv.classList.add('hidden');
     resultsDiv.classList.remove('hidden');
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Teste do background_jobs: limites por grupo (fila), pedidos repetidos, progresso
+(também de threads), cancelamento (na fila, em curso, em threads) e persistência.
+
+    python test_background_jobs.py
+"""
+import asyncio
+import time
+
+import background_jobs
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_group_limit_queues():
+    async def main():
+        manager = background_jobs.JobManager(max_running=4, limits={"scrape": 1})
+        order = []
+
+        async def work(job):
+            order.append(("start", job.params["n"]))
+            await asyncio.sleep(0.05)
+            order.append(("end", job.params["n"]))
+            return job.params["n"]
+
+        jobs = [manager.submit("scrape", work, {"n": n}, group="scrape") for n in range(3)]
+        await asyncio.sleep(0.01)
+        assert [j.status for j in jobs] == ["running", "queued", "queued"], [j.status for j in jobs]
+        for job in jobs:
+            await manager.wait(job)
+        assert [j.result for j in jobs] == [0, 1, 2]
+        # um de cada vez
+        assert order == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)], order
+
+    _run(main())
+
+
+def test_duplicate_submit_returns_running_job():
+    async def main():
+        manager = background_jobs.JobManager()
+
+        async def work(job):
+            await asyncio.sleep(0.02)
+            return "ok"
+
+        first = manager.submit("refresh", work)
+        assert manager.submit("refresh", work) is first
+        assert manager.submit("refresh", work, {"other": 1}) is not first
+        await manager.wait(first)
+        again = manager.submit("refresh", work)
+        assert again is not first
+        assert manager.stats["deduplicated"] == 1
+        await asyncio.gather(*(manager.wait(j) for j in manager.list()))
+
+    _run(main())
+
+
+def test_progress_from_thread_and_subscribe():
+    async def main():
+        manager = background_jobs.JobManager()
+
+        def blocking(job):
+            for i in range(1, 6):
+                time.sleep(0.01)
+                job.progress(i, 5, f"item {i}")
+            return "done"
+
+        async def work(job):
+            return await job.run_in_thread(blocking, job)
+
+        job = manager.submit("photos", work)
+        queue = manager.subscribe(job.id)
+        seen = []
+        while not job.finished:
+            seen.append(await queue.get())
+        manager.unsubscribe(job.id, queue)
+        assert job.result == "done"
+        assert seen[-1]["status"] == "done" and seen[-1]["percent"] == 100.0, seen[-1]
+        assert any(s["status"] == "running" for s in seen)
+
+    _run(main())
+
+
+def test_cancel():
+    async def main():
+        manager = background_jobs.JobManager(limits={"backup": 1})
+        cleaned = []
+
+        def blocking(job):
+            try:
+                while True:
+                    job.check_cancelled()
+                    time.sleep(0.01)
+            finally:
+                cleaned.append(job.id)
+
+        async def work(job):
+            return await job.run_in_thread(blocking, job)
+
+        running = manager.submit("backup", work, {"n": 1})
+        queued = manager.submit("backup", work, {"n": 2})
+        await asyncio.sleep(0.05)
+        assert running.status == "running" and queued.status == "queued"
+
+        manager.cancel(queued.id)
+        assert queued.status == "cancelled"
+        manager.cancel(running.id)
+        await manager.wait(running)
+        # a thread terminou (limpeza feita) antes de o job ficar "cancelled"
+        assert running.status == "cancelled" and cleaned == [running.id]
+
+        # cancelado logo a seguir ao submit (task criada mas ainda não arrancou)
+        calls = []
+
+        async def never(job):
+            calls.append(job.id)
+
+        job = manager.submit("backup", never, {"n": 3})
+        manager.cancel(job.id)
+        await manager.wait(job)
+        assert job.status == "cancelled" and not calls
+        assert manager.stats["cancelled"] == 3
+
+    _run(main())
+
+
+def test_failure_and_persist():
+    async def main():
+        snapshots = []
+        manager = background_jobs.JobManager(persist=snapshots.append, persist_interval=10)
+
+        async def work(job):
+            for i in range(100):
+                job.progress(i, 100)
+            raise RuntimeError("pg_dump exit 1")
+
+        job = manager.submit("backup", work)
+        await manager.wait(job)
+        await asyncio.sleep(0.05)
+        assert job.status == "failed" and job.error == "pg_dump exit 1"
+        # mudanças de estado sempre; progresso no máximo a cada persist_interval
+        assert [s["status"] for s in snapshots] == ["queued", "running", "failed"], [s["status"] for s in snapshots]
+
+    _run(main())
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    test_group_limit_queues()
+    test_duplicate_submit_returns_running_job()
+    test_progress_from_thread_and_subscribe()
+    test_cancel()
+    test_failure_and_persist()
+    print(f"✅ background_jobs OK ({time.perf_counter() - started:.2f}s)")
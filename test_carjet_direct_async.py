@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Teste do scrape_carjet_direct_async contra um servidor local que reproduz o CarJet
+com as páginas guardadas (sem rede):
+
+    POST /do/list/pt        → carjet_html_source.html ("Waiting Prices" + redirect)
+    GET  /do/list/pt?s=...  → carjet_html_debug.html ("A carregar...") nas primeiras
+                              LOADING_POLLS tentativas, depois carjet_group_*.html
+
+Verifica resultados iguais ao parse direto, POST sem cookies, GET com cookies EUR,
+várias pesquisas em simultâneo e o limite de pedidos por host.
+
+    python test_carjet_direct_async.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import carjet_direct
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOADING_POLLS = 2
+SEARCHES = 6
+MAX_CONCURRENCY = 2
+RESULT_FIXTURES = ["carjet_group_M2.html", "carjet_group_L1.html", "carjet_group_N.html"]
+
+
+def _read(name: str) -> bytes:
+    with open(os.path.join(BASE_DIR, name), "rb") as f:
+        return f.read()
+
+
+WAITING_PAGE = _read("carjet_html_source.html")
+LOADING_PAGE = _read("carjet_html_debug.html")
+RESULT_PAGES = [_read(name) for name in RESULT_FIXTURES]
+REDIRECT_RX = re.compile(rb"window\.location\.replace\('[^']+'\)")
+
+
+class StandInState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.errors = []
+
+
+STATE = StandInState()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _enter(self):
+        with STATE.lock:
+            STATE.in_flight += 1
+            STATE.max_in_flight = max(STATE.max_in_flight, STATE.in_flight)
+        time.sleep(0.05)  # latência para que os pedidos se sobreponham
+
+    def _leave(self):
+        with STATE.lock:
+            STATE.in_flight -= 1
+
+    def _send(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "tracking=1; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self._enter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            form = self.rfile.read(length).decode("utf-8")
+            if self.headers.get("Cookie"):
+                STATE.errors.append(f"POST com cookies: {self.headers.get('Cookie')}")
+            session = re.search(r"frmSession=([0-9a-f-]+)", form).group(1)
+            with STATE.lock:
+                STATE.sessions[session] = 0
+            redirect = f"window.location.replace('/do/list/pt?s={session}')".encode()
+            self._send(REDIRECT_RX.sub(redirect, WAITING_PAGE))
+        finally:
+            self._leave()
+
+    def do_GET(self):
+        self._enter()
+        try:
+            if "monedaForzada=EUR" not in (self.headers.get("Cookie") or ""):
+                STATE.errors.append("GET sem cookies EUR")
+            session = self.path.split("s=", 1)[-1]
+            with STATE.lock:
+                polls = STATE.sessions.get(session, 0) + 1
+                STATE.sessions[session] = polls
+                index = list(STATE.sessions).index(session) if session in STATE.sessions else 0
+            if polls <= LOADING_POLLS:
+                self._send(LOADING_PAGE)
+            else:
+                self._send(RESULT_PAGES[index % len(RESULT_PAGES)])
+        finally:
+            self._leave()
+
+
+def start_stand_in_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def run_searches(base_url: str):
+    start_dt = datetime.now() + timedelta(days=30)
+    end_dt = start_dt + timedelta(days=7)
+    try:
+        return await asyncio.gather(*[
+            carjet_direct.scrape_carjet_direct_async("Faro", start_dt, end_dt, base_url=base_url)
+            for _ in range(SEARCHES)
+        ])
+    finally:
+        await carjet_direct.close_direct_client()
+
+
+def test_scrape_carjet_direct_async_stand_in():
+    carjet_direct.CARJET_MAX_CONCURRENCY = MAX_CONCURRENCY
+    carjet_direct.POLL_FIRST_DELAY = 0.1
+    carjet_direct.POLL_MIN_DELAY = 0.05
+    carjet_direct.POLL_MAX_DELAY = 0.2
+    carjet_direct.POLL_BUDGET = 5.0
+
+    server = start_stand_in_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = [len(carjet_direct.parse_carjet_html_complete(page.decode("utf-8"))) for page in RESULT_PAGES]
+            t0 = time.perf_counter()
+            results = asyncio.run(run_searches(base_url))
+            elapsed = time.perf_counter() - t0
+    finally:
+        server.shutdown()
+
+    assert not STATE.errors, STATE.errors
+    assert len(results) == SEARCHES
+    for items in results:
+        assert len(items) in expected and len(items) > 0, len(items)
+    assert all(polls == LOADING_POLLS + 1 for polls in STATE.sessions.values()), STATE.sessions
+    assert STATE.max_in_flight <= MAX_CONCURRENCY, STATE.max_in_flight
+    print(f"✅ {SEARCHES} pesquisas em {elapsed:.2f}s | carros: {[len(r) for r in results]} | "
+          f"pedidos simultâneos (máx): {STATE.max_in_flight}")
+
+
+if __name__ == "__main__":
+    test_scrape_carjet_direct_async_stand_in()
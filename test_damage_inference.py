@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Teste do DamageInferenceService (vehicle_damage_ai) com um modelo stub, sem
+transformers nem download do modelo:
+
+    DAMAGE_MODEL_FACTORY=test_damage_inference:stub_damage_model
+
+O stub classifica pela cor da imagem e demora STUB_BATCH_SECONDS por chamada,
+seja qual for o tamanho do batch (como um modelo real em CPU/GPU com batch).
+
+Verifica resultados por imagem, agrupamento em micro-batches, cache por hash,
+imagens iguais em simultâneo com uma só inferência, imagens inválidas sem
+estragar o resto do batch e o event loop livre durante a inferência.
+
+    python test_damage_inference.py
+"""
+import asyncio
+import io
+import multiprocessing
+import time
+
+from PIL import Image
+
+import vehicle_damage_ai
+
+STUB_FACTORY = "test_damage_inference:stub_damage_model"
+STUB_BATCH_SECONDS = 0.2
+MAX_BATCH = 8
+IMAGES = 16
+
+
+def stub_damage_model():
+    """Vermelho -> DENT, azul -> SCRATCH (dúvida), resto -> sem dano"""
+    def predict(images):
+        time.sleep(STUB_BATCH_SECONDS)
+        predictions = []
+        for image in images:
+            r, g, b = image.convert("RGB").resize((1, 1)).getpixel((0, 0))
+            if r > 200 and g < 100:
+                top = ("DENT", 0.92)
+            elif b > 200 and r < 100:
+                top = ("SCRATCH", 0.41)
+            else:
+                top = ("NO DAMAGE", 0.88)
+            predictions.append([
+                {"label": top[0], "score": top[1]},
+                {"label": "CRACK", "score": round(1 - top[1], 2)},
+            ])
+        return predictions
+    return predict
+
+
+def _jpeg(color) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(out, "JPEG")
+    return out.getvalue()
+
+
+def _new_service(**kwargs):
+    return vehicle_damage_ai.DamageInferenceService(
+        workers=1, max_batch=MAX_BATCH, max_wait_ms=30, factory=STUB_FACTORY,
+        mp_context=multiprocessing.get_context("spawn"), **kwargs)
+
+
+async def _ticker(stop: asyncio.Event, gaps: list):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+
+async def run_checks():
+    service = _new_service()
+    try:
+        # Arranque dos workers fora das medições
+        await service.analyze(_jpeg((0, 255, 0)))
+        batches_before = service.stats["batches"]
+
+        colors = [(230, 20, 20) if i % 3 == 0 else (20, 20, 230) if i % 3 == 1 else (20, 200, 20)
+                  for i in range(IMAGES)]
+        # tons ligeiramente diferentes -> imagens (e hashes) todas diferentes
+        images = [_jpeg((r, g + i, b)) for i, (r, g, b) in enumerate(colors)]
+
+        stop, gaps = asyncio.Event(), []
+        ticker = asyncio.create_task(_ticker(stop, gaps))
+        started = time.perf_counter()
+        results = await service.analyze_many(images)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+
+        for i, result in enumerate(results):
+            assert result["ok"], result
+            if i % 3 == 0:
+                assert result["has_damage"] and result["damage_type"] == "DENT", result
+            elif i % 3 == 1:
+                assert not result["has_damage"] and result["verdict"].startswith("POSSIBLE SCRATCH"), result
+            else:
+                assert not result["has_damage"] and result["verdict"] == "NO DAMAGE", result
+
+        batches = service.stats["batches"] - batches_before
+        assert batches == -(-IMAGES // MAX_BATCH), batches
+        # um a um seriam IMAGES * STUB_BATCH_SECONDS
+        assert elapsed < IMAGES * STUB_BATCH_SECONDS / 2, elapsed
+        assert max(gaps) < STUB_BATCH_SECONDS / 2, max(gaps)
+
+        # Cache: as mesmas imagens não voltam ao modelo
+        again = await service.analyze_many(images)
+        assert all(r.get("cached") for r in again)
+        assert service.stats["batches"] - batches_before == batches
+
+        # Imagens iguais em voo partilham a inferência
+        duplicate = _jpeg((250, 10, 10))
+        same = await asyncio.gather(*(service.analyze(duplicate) for _ in range(5)))
+        assert all(r["damage_type"] == "DENT" for r in same)
+        assert service.stats["deduped"] == 4, service.stats
+
+        # Imagem inválida: erro só nessa
+        mixed = await service.analyze_many([b"not an image", _jpeg((10, 10, 250))])
+        assert not mixed[0]["ok"] and mixed[1]["ok"], mixed
+
+        snapshot = service.snapshot()
+        assert snapshot["batch_ms"] and snapshot["last_batch"]["images"] == 2, snapshot
+        return elapsed, batches, max(gaps), snapshot
+    finally:
+        service.shutdown()
+
+
+def test_damage_inference_service_stub_model():
+    elapsed, batches, max_gap, snapshot = asyncio.run(run_checks())
+    print(f"✅ {IMAGES} imagens em {elapsed:.2f}s ({batches} batches, máx {MAX_BATCH}) | "
+          f"event loop: maior pausa {max_gap * 1000:.0f} ms | "
+          f"batch p95 {snapshot['batch_ms']['p95']} ms, fila p95 {snapshot['queue_wait_ms']['p95']} ms")
+
+
+if __name__ == "__main__":
+    test_damage_inference_service_stub_model()
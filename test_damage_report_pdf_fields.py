@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Teste do PDF dos Damage Reports em SQLite: grava um DR por /api/damage-reports/create,
+descarrega /api/damage-reports/{dr}/pdf e confirma os km e o combustível de
+levantamento/devolução (colunas vehicle_km, fuel_pickup e fuel_return).
+
+    python test_damage_report_pdf_fields.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+WORKDIR = tempfile.mkdtemp(prefix="dr_pdf_")
+shutil.copy(os.path.join(ROOT, "Damage Report.pdf"), WORKDIR)
+os.chdir(WORKDIR)  # data.db e o template ficam no diretório de trabalho
+os.environ["DATA_DIR"] = WORKDIR
+sys.path.insert(0, ROOT)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+
+import httpx
+from PyPDF2 import PdfReader
+
+HEADERS = {"X-Internal-Request": "scheduler"}
+FIELDS = {"vehicleKm": 300, "fuel_level_pickup": 400, "fuel_level_return": 500}  # field_id -> y
+
+
+def _setup_tables():
+    """Tabelas que no PostgreSQL vêm do _ensure_damage_reports_tables (que salta o SQLite)"""
+    con = main._db_connect()
+    try:
+        # Colunas que as gravações do DR escrevem (o CREATE TABLE do SQLite no endpoint é o antigo)
+        con.execute("""CREATE TABLE IF NOT EXISTS damage_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, dr_number TEXT UNIQUE, ra_number TEXT, contract_number TEXT,
+            date DATE, client_name TEXT, client_email TEXT, client_phone TEXT, client_address TEXT,
+            client_city TEXT, client_postal_code TEXT, client_country TEXT, vehicle_plate TEXT,
+            vehicle_model TEXT, vehicle_brand TEXT, vehicle_color TEXT, vehicle_km TEXT,
+            pickup_date DATETIME, pickup_time TEXT, pickup_location TEXT, return_date DATETIME,
+            return_time TEXT, return_location TEXT, issued_by TEXT, inspection_type TEXT,
+            inspector_name TEXT, mileage INTEGER, fuel_level TEXT, fuel_pickup TEXT, fuel_return TEXT,
+            total_cost REAL, inspection_date TEXT, damage_description TEXT, observations TEXT,
+            damage_diagram_data TEXT, repair_items TEXT, damage_images TEXT, vehicle_damage_image BLOB,
+            total_amount REAL, status TEXT DEFAULT 'draft', pdf_data BLOB, pdf_filename TEXT,
+            is_protected INTEGER DEFAULT 0, is_deleted INTEGER DEFAULT 0, deleted_at TIMESTAMP,
+            deleted_by TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, created_by TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+        con.execute("""CREATE TABLE IF NOT EXISTS damage_report_numbering (
+            id INTEGER PRIMARY KEY, current_year INTEGER NOT NULL, current_number INTEGER NOT NULL,
+            prefix TEXT DEFAULT 'DR', updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+        con.execute("""CREATE TABLE IF NOT EXISTS damage_report_coordinates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, field_id TEXT NOT NULL, x REAL NOT NULL, y REAL NOT NULL,
+            width REAL NOT NULL, height REAL NOT NULL, page INTEGER DEFAULT 1, field_type TEXT,
+            template_version INTEGER DEFAULT 1, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+        # Sem template ativo na BD usa-se o "Damage Report.pdf" do diretório de trabalho
+        con.execute("""CREATE TABLE IF NOT EXISTS damage_report_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, version INTEGER, filename TEXT, file_data BLOB,
+            num_pages INTEGER, uploaded_by TEXT, uploaded_at TEXT, is_active INTEGER DEFAULT 0, notes TEXT)""")
+        con.commit()
+    finally:
+        con.close()
+
+
+def _map_fields():
+    """Coordenadas só para os três campos, em linhas separadas da 1ª página"""
+    con = main._db_connect()
+    try:
+        con.execute("DELETE FROM damage_report_coordinates")
+        for field_id, y in FIELDS.items():
+            con.execute("INSERT INTO damage_report_coordinates (field_id, x, y, width, height, page) VALUES (?, ?, ?, ?, ?, 1)",
+                        (field_id, 40, y, 200, 14))
+        con.commit()
+    finally:
+        con.close()
+    main._damage_pdf_template_changed()
+
+
+def _lines(pdf: bytes) -> list:
+    text = PdfReader(io.BytesIO(pdf)).pages[0].extract_text() or ""
+    return [line.strip() for line in text.splitlines()]
+
+
+def test_saved_report_pdf_has_km_and_both_fuel_levels():
+    _setup_tables()
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            saved = await client.post("/api/damage-reports/create", headers=HEADERS, json={
+                "raNumber": "RA-9001", "clientName": "Cliente Teste", "vehiclePlate": "AA-00-BB",
+                "vehicleKm": "48213", "fuelPickup": "7/8", "fuelReturn": "1/4",
+            })
+            assert saved.status_code == 200 and saved.json().get("ok"), saved.text
+            dr_number = saved.json()["dr_number"]
+            _map_fields()
+            pdf = await client.get(f"/api/damage-reports/{dr_number}/pdf", headers=HEADERS)
+            assert pdf.status_code == 200 and pdf.headers["content-type"] == "application/pdf", pdf.text[:200]
+            return pdf.content
+
+    lines = _lines(asyncio.run(run()))
+    for value in ("48.213", "7/8", "1/4"):  # km com separador de milhares (damage_report_pdf)
+        assert value in lines, (value, lines)
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    test_saved_report_pdf_has_km_and_both_fuel_levels()
+    print(f"✅ Damage Report PDF fields OK ({time.perf_counter() - started:.2f}s)")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Teste do ra_extractor com o test_rental_agreement.pdf (gerado pelo
+test_ra_extraction_with_coords.py): campos por coordenadas, convenção das
+coordenadas resolvida uma vez por plan, uma leitura por página, fallback por
+padrões e batch num pool de processos.
+
+    python test_ra_extractor.py
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+import ra_extractor
+
+PDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_rental_agreement.pdf")
+PAGE_HEIGHT = 841.8897705078125  # A4
+
+# field_id: (x, linha de base a partir do topo, largura) - onde o PDF de teste escreve cada campo
+LAYOUT = {
+    "contractNumber": (14, 97, 100),
+    "clientName": (12, 130, 200),
+    "address": (293, 96.5, 140),
+    "vehicleBrandModel": (442, 96.5, 140),
+    "vehiclePlate": (292, 182.5, 140),
+    "pickupTime": (442.5, 182.5, 100),
+    "pickupLocation": (442.5, 210, 140),
+    "pickupDate": (292.6569, 237, 140),
+    "pickupFuel": (442, 237, 60),
+    "country": (13.5, 271, 60),
+    "postalCodeCity": (13.5, 351.5, 95),
+    "clientPhone": (110, 351.5, 160),
+}
+
+EXPECTED = {
+    "contractNumber": "06424-09", "raNumber": "06424-09", "clientName": "EIKE BERENS",
+    "address": "RUA EXEMPLO 123", "vehiclePlate": "AB-12-CD", "pickupTime": "10:30",
+    "pickupLocation": "AUTO PRUDENTE", "pickupDate": "06-11-2025", "pickupFuel": "3/4",
+    "country": "DE", "postalCodeCity": "8000-000 / FARO", "postalCode": "8000-000", "city": "FARO",
+    "clientPhone": "+351 912345678", "vehicleBrandModel": "FIAT 500",
+}
+
+
+def _coordinates(convention="DIRETO"):
+    rows = []
+    for field_id, (x, baseline, width) in LAYOUT.items():
+        # retângulo como o do mapeador: a linha de texto inteira (Y do topo)
+        x, y, w, h = x, baseline - 12, width, 14
+        if convention == "INVERTIDO_Y":
+            y = PAGE_HEIGHT - y - h
+        elif convention == "ESCALA_2":
+            x, y, w, h = x * 2, y * 2, w * 2, h * 2
+        rows.append((field_id, x, y, w, h, 1))
+    return rows
+
+
+def _pdf() -> bytes:
+    with open(PDF_PATH, "rb") as f:
+        return f.read()
+
+
+def test_mapped_fields():
+    plan = ra_extractor.ExtractionPlan(_coordinates())
+    result = ra_extractor.extract(plan, _pdf())
+    assert result["method"] == "mapped_coordinates", result
+    assert result["fields"] == EXPECTED, result["fields"]
+    assert plan.convention == "DIRETO"
+
+
+def test_convention_resolved_once_per_plan():
+    pdf = _pdf()
+    for convention in ("INVERTIDO_Y", "ESCALA_2"):
+        plan = ra_extractor.ExtractionPlan(_coordinates(convention))
+        assert plan.convention is None
+        assert ra_extractor.extract(plan, pdf)["fields"] == EXPECTED
+        assert plan.convention == convention, (convention, plan.convention)
+
+    # Resolvida: os RAs seguintes já não experimentam as outras convenções
+    calls = []
+    original = ra_extractor.resolve_convention
+    ra_extractor.resolve_convention = lambda *a: calls.append(a) or original(*a)
+    try:
+        ra_extractor.extract(plan, pdf)
+    finally:
+        ra_extractor.resolve_convention = original
+    assert not calls
+
+
+def test_one_text_read_per_page():
+    calls = []
+    original = fitz.Page.get_text
+
+    def counting_get_text(page, *args, **kwargs):
+        calls.append(args[0] if args else kwargs.get("option"))
+        return original(page, *args, **kwargs)
+
+    fitz.Page.get_text = counting_get_text
+    try:
+        # plan novo: a primeira leitura serve também para resolver a convenção
+        ra_extractor.extract(ra_extractor.ExtractionPlan(_coordinates("INVERTIDO_Y")), _pdf())
+    finally:
+        fitz.Page.get_text = original
+    assert calls == ["rawdict"], calls
+
+
+def test_pattern_fallback():
+    pdf = _pdf()
+    for plan in (None, ra_extractor.ExtractionPlan([])):
+        result = ra_extractor.extract(plan, pdf)
+        assert result["method"] == "pattern_based", result
+        assert result["fields"]["contractNumber"] == "06424-09"
+        assert result["fields"]["vehiclePlate"] == "AB-12-CD"
+
+    # Coordenadas que não apanham nada -> padrões
+    empty = ra_extractor.ExtractionPlan([("clientName", 500, 800, 20, 10, 1)])
+    assert ra_extractor.extract(empty, pdf)["method"] == "pattern_based"
+    assert empty.convention is None
+
+
+def test_batch_in_process_pool():
+    pdf = _pdf()
+    plan = ra_extractor.ExtractionPlan(_coordinates("ESCALA_2"))
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=2, mp_context=ctx) as pool:
+        futures = [pool.submit(ra_extractor.extract_batch, plan.key, plan.coordinates, plan.convention,
+                               [pdf] * 4 + [b"not a pdf"]) for _ in range(2)]
+        parts = [f.result() for f in futures]
+    for part in parts:
+        assert part["convention"] == "ESCALA_2"
+        assert [r["fields"] for r in part["results"][:4]] == [EXPECTED] * 4
+        assert not part["results"][4]["ok"]
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    test_mapped_fields()
+    test_convention_resolved_once_per_plan()
+    test_one_text_read_per_page()
+    test_pattern_fallback()
+    test_batch_in_process_pool()
+    print(f"✅ ra_extractor OK ({time.perf_counter() - started:.2f}s)")
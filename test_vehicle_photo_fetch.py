@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Teste do vehicle_photo_fetch (sem rede, httpx.MockTransport): concorrência limitada,
+pedidos condicionais (304), sha256 do conteúdo e limpeza dos model_key.
+
+    python test_vehicle_photo_fetch.py
+"""
+import asyncio
+import hashlib
+import time
+
+import httpx
+
+import vehicle_photo_fetch
+
+ETAG = '"v1"'
+
+
+def _client(state):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(0.02)
+            if request.url.path.endswith("missing.jpg"):
+                return httpx.Response(404)
+            if request.headers.get("If-None-Match") == ETAG:
+                return httpx.Response(304)
+            return httpx.Response(200, content=b"IMG" + request.url.path.encode(),
+                                  headers={"content-type": "image/jpeg", "etag": ETAG})
+        finally:
+            state["active"] -= 1
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_bounded_concurrency_and_hashes():
+    async def main():
+        state = {"active": 0, "peak": 0}
+        urls = {f"https://cdn/car_{i}.jpg": None for i in range(20)}
+        urls["https://cdn/missing.jpg"] = None
+        throughput = vehicle_photo_fetch.Throughput(4)
+        done = []
+        async with _client(state) as client:
+            fetches = await vehicle_photo_fetch.fetch_all(client, urls, 4, done.append, throughput)
+        assert state["peak"] == 4, state
+        assert len(done) == 21
+        ok = fetches["https://cdn/car_3.jpg"]
+        assert ok.status == vehicle_photo_fetch.OK and ok.etag == ETAG
+        assert ok.sha256 == hashlib.sha256(b"IMG/car_3.jpg").hexdigest()
+        missing = fetches["https://cdn/missing.jpg"]
+        assert missing.status == vehicle_photo_fetch.ERROR and missing.error == "HTTP 404"
+        report = throughput.report()
+        assert (report["downloaded"], report["failed"], report["unique_images"]) == (20, 1, 20), report
+
+    asyncio.run(main())
+
+
+def test_conditional_requests():
+    async def main():
+        state = {"active": 0, "peak": 0}
+        async with _client(state) as client:
+            fetches = await vehicle_photo_fetch.fetch_all(client, {
+                "https://cdn/a.jpg": (ETAG, None),
+                "https://cdn/b.jpg": ('"old"', "Mon, 01 Jan 2024 00:00:00 GMT"),
+            })
+        not_modified = fetches["https://cdn/a.jpg"]
+        assert not_modified.status == vehicle_photo_fetch.NOT_MODIFIED and not_modified.data is None
+        assert not_modified.etag == ETAG  # validadores mantêm-se para o próximo run
+        assert fetches["https://cdn/b.jpg"].status == vehicle_photo_fetch.OK
+
+    asyncio.run(main())
+
+
+def test_clean_model_key():
+    assert vehicle_photo_fetch.clean_model_key("Fiat 500 ou similar | Pequeno") == "fiat 500"
+    assert vehicle_photo_fetch.clean_model_key("  Renault  Clio   Compacto ") == "renault clio"
+    assert vehicle_photo_fetch.clean_model_key("VW Polo or Similar") == "vw polo"
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    test_bounded_concurrency_and_hashes()
+    test_conditional_requests()
+    test_clean_model_key()
+    print(f"✅ vehicle_photo_fetch OK ({time.perf_counter() - started:.2f}s)")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Teste do _WhatsAppIngest (fila do webhook WhatsApp) em SQLite: lotes, mensagens
+repetidas da Meta, unread_count, itens mal formados e retry/descarte com gravação
+um a um quando o lote falha.
+
+    python test_whatsapp_ingest.py
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+WORKDIR = tempfile.mkdtemp(prefix="wa_ingest_")
+os.chdir(WORKDIR)  # o data.db do SQLite fica no diretório de trabalho
+os.environ["DATA_DIR"] = WORKDIR
+os.environ.setdefault("WHATSAPP_INGEST_MAX_ATTEMPTS", "2")
+os.environ.setdefault("WHATSAPP_INGEST_RETRY_SECONDS", "0.01")
+sys.path.insert(0, ROOT)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+
+DDL = (
+    """CREATE TABLE IF NOT EXISTS whatsapp_contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, phone_number TEXT NOT NULL UNIQUE,
+        has_whatsapp INTEGER, profile_picture_url TEXT, created_at TEXT DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE IF NOT EXISTS whatsapp_conversations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, contact_id INTEGER, phone_number TEXT NOT NULL UNIQUE,
+        last_message_at TEXT DEFAULT CURRENT_TIMESTAMP, last_message_preview TEXT, unread_count INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'open', assigned_to TEXT, created_at TEXT DEFAULT CURRENT_TIMESTAMP)""",
+    """CREATE TABLE IF NOT EXISTS whatsapp_messages (
+        id TEXT PRIMARY KEY, conversation_id INTEGER, message_text TEXT, direction TEXT NOT NULL,
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP, received_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'sent', sender_name TEXT)""",
+)
+
+
+def _reset():
+    con = main._db_connect()
+    try:
+        for table in ("whatsapp_messages", "whatsapp_conversations", "whatsapp_contacts"):
+            con.execute(f"DROP TABLE IF EXISTS {table}")
+        for ddl in DDL:
+            con.execute(ddl)
+        con.commit()
+    finally:
+        con.close()
+
+
+def _query(sql, params=()):
+    con = main._db_connect()
+    try:
+        return con.execute(sql, params).fetchall()
+    finally:
+        con.close()
+
+
+def _message(message_id, phone, text="olá", timestamp=None):
+    return {"from": phone, "id": message_id, "type": "text", "text": {"body": text},
+            "timestamp": str(int(time.time())) if timestamp is None else timestamp}
+
+
+def _webhook(*messages, statuses=()):
+    phones = {m["from"] for m in messages if isinstance(m, dict)}
+    return {"entry": [{"changes": [{"value": {
+        "contacts": [{"wa_id": p, "profile": {"name": f"Cliente {p}"}} for p in phones],
+        "messages": list(messages),
+        "statuses": list(statuses),
+    }}]}]}
+
+
+def _unread():
+    return dict(_query("SELECT phone_number, unread_count FROM whatsapp_conversations"))
+
+
+def test_batch_and_unread():
+    _reset()
+    ingest = main._WhatsAppIngest()
+    queued = ingest.submit_webhook(_webhook(_message("m1", "351900"), _message("m2", "351900"), _message("m3", "351911")))
+    ingest.flush()
+    assert queued == 3
+    assert {r[0] for r in _query("SELECT id FROM whatsapp_messages")} == {"m1", "m2", "m3"}
+    assert _unread() == {"351900": 2, "351911": 1}, _unread()
+    assert ingest.stats["batches"] == 1 and ingest.stats["messages_written"] == 3, ingest.stats
+
+
+def test_redelivery_is_ignored():
+    _reset()
+    ingest = main._WhatsAppIngest()
+    ingest.submit_webhook(_webhook(_message("m1", "351900")))
+    ingest.flush()
+    # a mesma mensagem outra vez: na memória (_seen) e, noutro processo, na BD
+    assert ingest.submit_webhook(_webhook(_message("m1", "351900"))) == 0
+    ingest.flush()
+    other = main._WhatsAppIngest()
+    other.submit_webhook(_webhook(_message("m1", "351900")))
+    other.flush()
+    assert _query("SELECT COUNT(*) FROM whatsapp_messages")[0][0] == 1
+    assert _unread() == {"351900": 1}, _unread()
+    assert ingest.stats["duplicates"] == 1 and other.stats["duplicates"] == 1
+
+
+def test_invalid_item_does_not_sink_the_batch():
+    _reset()
+    ingest = main._WhatsAppIngest()
+    queued = ingest.submit_webhook(_webhook(_message("ok1", "351900"), _message("bad", "351900", timestamp="ontem"),
+                                            _message("ok2", "351911"), statuses=["not a status"]))
+    ingest.flush()
+    assert queued == 2 and ingest.stats["invalid"] == 2, ingest.stats
+    assert {r[0] for r in _query("SELECT id FROM whatsapp_messages")} == {"ok1", "ok2"}
+
+
+def test_failed_item_retried_alone_then_dropped():
+    _reset()
+    ingest = main._WhatsAppIngest()
+    original = ingest._write_messages
+
+    def failing(con, messages):
+        if any(m["message_id"] == "poison" for m in messages):
+            raise RuntimeError("bad row")
+        return original(con, messages)
+
+    ingest._write_messages = failing
+    ingest.submit_webhook(_webhook(_message("a1", "351900"), _message("poison", "351911"), _message("a2", "351900")))
+    ingest.flush()
+    # os outros foram gravados um a um; o mau tentou WHATSAPP_INGEST_MAX_ATTEMPTS vezes
+    assert {r[0] for r in _query("SELECT id FROM whatsapp_messages")} == {"a1", "a2"}
+    assert _unread() == {"351900": 2}, _unread()
+    assert ingest.stats["dropped"] == 1 and ingest.stats["retries"] == main.WHATSAPP_INGEST_MAX_ATTEMPTS - 1, ingest.stats
+
+    # descartado: uma redelivery da Meta volta a entrar
+    ingest._write_messages = original
+    assert ingest.submit_webhook(_webhook(_message("poison", "351911"))) == 1
+    ingest.flush()
+    assert _query("SELECT COUNT(*) FROM whatsapp_messages WHERE id = 'poison'")[0][0] == 1
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    test_batch_and_unread()
+    test_redelivery_is_ignored()
+    test_invalid_item_does_not_sink_the_batch()
+    test_failed_item_retried_alone_then_dropped()
+    print(f"✅ WhatsApp ingest OK ({time.perf_counter() - started:.2f}s)")
@@ -4,34 +4,59 @@ FREE - Uses Hugging Face model (no API costs)
 Model: beingamit99/car_damage_detection
 """
 
+import asyncio
+import hashlib
+import importlib
 import logging
+import os
+import time
+from collections import OrderedDict, deque
 from PIL import Image
 import io
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+DAMAGE_MODEL = os.getenv("DAMAGE_MODEL", "beingamit99/car_damage_detection")
+# "module:callable" returning a model used instead of the Hugging Face pipeline
+# (e.g. the stub model in test_damage_inference.py)
+DAMAGE_MODEL_FACTORY = os.getenv("DAMAGE_MODEL_FACTORY", "")
+
+# Known damage types: GLASS SHATTER, DENT, LAMP BROKEN, SCRATCH, CRACK
+DAMAGE_TYPES = ['GLASS SHATTER', 'DENT', 'LAMP BROKEN', 'SCRATCH', 'CRACK']
+
 # Global model instance (loaded once at startup)
+# A model is a callable: list of PIL images -> list of predictions per image
+# (each a list of {"label", "score"} sorted by score, like the HF pipeline)
 _damage_detector = None
 
-def load_damage_detection_model():
+def _hugging_face_model(model_name: str):
+    from transformers import pipeline
+    
+    classifier = pipeline(
+        "image-classification",
+        model=model_name
+    )
+    return lambda images: classifier(images, batch_size=len(images))
+
+def load_damage_detection_model(factory: Optional[str] = None):
     """
     Load AI model at startup (downloads once, then cached)
-    Call this in FastAPI startup event
+    Called once per inference worker process (DamageInferenceService)
     """
     global _damage_detector
     
     if _damage_detector is not None:
         return _damage_detector
     
+    factory = DAMAGE_MODEL_FACTORY if factory is None else factory
     try:
         logger.info("Loading vehicle damage detection AI model...")
-        from transformers import pipeline
-        
-        _damage_detector = pipeline(
-            "image-classification",
-            model="beingamit99/car_damage_detection"
-        )
+        if factory:
+            module_name, _, attr = factory.partition(":")
+            _damage_detector = getattr(importlib.import_module(module_name), attr)()
+        else:
+            _damage_detector = _hugging_face_model(DAMAGE_MODEL)
         
         logger.info("✅ AI model loaded successfully!")
         return _damage_detector
@@ -41,6 +66,84 @@ def load_damage_detection_model():
         return None
 
 
+def _damage_result(predictions: List[Dict]) -> Dict[str, Any]:
+    """Verdict for one image from its predictions"""
+    top_prediction = predictions[0]
+    damage_type = top_prediction['label']
+    confidence = top_prediction['score']
+    
+    # Determine if damaged
+    has_damage = False
+    verdict = "NO DAMAGE"
+    
+    if damage_type in DAMAGE_TYPES and confidence > 0.5:
+        has_damage = True
+        verdict = f"{damage_type} DETECTED"
+    elif damage_type in DAMAGE_TYPES and confidence > 0.3:
+        verdict = f"POSSIBLE {damage_type} (needs review)"
+    
+    return {
+        "ok": True,
+        "has_damage": has_damage,
+        "damage_type": damage_type if has_damage else None,
+        "confidence": round(confidence, 4),
+        "confidence_percent": round(confidence * 100, 2),
+        "verdict": verdict,
+        "all_predictions": [
+            {
+                "type": p['label'],
+                "confidence": round(p['score'], 4),
+                "confidence_percent": round(p['score'] * 100, 2)
+            }
+            for p in predictions[:5]  # Top 5
+        ]
+    }
+
+
+def analyze_vehicle_damage_batch(images: List[bytes]) -> List[Dict[str, Any]]:
+    """
+    Analyze several vehicle images with one model call
+    
+    Images that fail to decode get their own error; the others are still analyzed.
+    Returns one result per image, same format as analyze_vehicle_damage.
+    """
+    global _damage_detector
+    
+    # Load model if not loaded
+    if _damage_detector is None:
+        _damage_detector = load_damage_detection_model()
+        
+    if _damage_detector is None:
+        return [{"ok": False, "error": "AI model not available"} for _ in images]
+    
+    results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+    decoded, positions = [], []
+    for i, image_bytes in enumerate(images):
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
+            decoded.append(image)
+            positions.append(i)
+        except Exception as e:
+            logger.error(f"Error analyzing image: {e}")
+            results[i] = {"ok": False, "error": str(e)}
+    
+    if decoded:
+        try:
+            # Run AI prediction (whole batch at once)
+            predictions = _damage_detector(decoded)
+            for i, image_predictions in zip(positions, predictions):
+                results[i] = _damage_result(image_predictions)
+        except Exception as e:
+            logger.error(f"Error analyzing images: {e}")
+            import traceback
+            traceback.print_exc()
+            for i in positions:
+                results[i] = {"ok": False, "error": str(e)}
+    
+    return results
+
+
 def analyze_vehicle_damage(image_bytes: bytes) -> Dict[str, Any]:
     """
     Analyze vehicle image for damage using AI
@@ -58,68 +161,199 @@ def analyze_vehicle_damage(image_bytes: bytes) -> Dict[str, Any]:
             "verdict": str
         }
     """
-    global _damage_detector
+    return analyze_vehicle_damage_batch([image_bytes])[0]
+
+
+# ============================================================
+# Inference service: model in worker processes, micro-batched
+# ============================================================
+
+def _init_inference_worker(factory: Optional[str]):
+    load_damage_detection_model(factory)
+
+
+def _infer_batch(images: List[bytes]):
+    """Runs in a worker process: (results, model seconds)"""
+    started = time.perf_counter()
+    results = analyze_vehicle_damage_batch(images)
+    return results, time.perf_counter() - started
+
+
+def _worker_ready() -> bool:
+    return _damage_detector is not None
+
+
+class DamageInferenceService:
+    """
+    Damage detection off the event loop
     
-    # Load model if not loaded
-    if _damage_detector is None:
-        _damage_detector = load_damage_detection_model()
-        
-    if _damage_detector is None:
-        return {
-            "ok": False,
-            "error": "AI model not available"
-        }
+    Images are queued; a batcher takes up to max_batch of them (waiting at most
+    max_wait_ms for the batch to fill) and runs one model call per batch in a
+    process pool whose workers each load the model once. Results are cached by
+    the sha256 of the image bytes, and identical images in flight share one
+    inference.
+    """
     
-    try:
-        # Load image
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Run AI prediction
-        predictions = _damage_detector(image)
-        
-        # Parse results
-        top_prediction = predictions[0]
-        damage_type = top_prediction['label']
-        confidence = top_prediction['score']
-        
-        # Determine if damaged
-        # Known damage types: GLASS SHATTER, DENT, LAMP BROKEN, SCRATCH, CRACK
-        damage_types = ['GLASS SHATTER', 'DENT', 'LAMP BROKEN', 'SCRATCH', 'CRACK']
-        
-        has_damage = False
-        verdict = "NO DAMAGE"
-        
-        if damage_type in damage_types and confidence > 0.5:
-            has_damage = True
-            verdict = f"{damage_type} DETECTED"
-        elif damage_type in damage_types and confidence > 0.3:
-            verdict = f"POSSIBLE {damage_type} (needs review)"
+    def __init__(self, workers: int = 1, max_batch: int = 8, max_wait_ms: float = 25.0,
+                 cache_size: int = 512, factory: Optional[str] = None, mp_context=None):
+        self.workers = max(1, workers)
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.cache_size = cache_size
+        self.factory = factory
+        self.mp_context = mp_context
+        self._pool = None
+        self._loop = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._running = set()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # (images, batch ms, model ms, queue wait ms) of the latest batches
+        self._batches = deque(maxlen=200)
+        self.stats = {"images": 0, "cache_hits": 0, "deduped": 0, "batches": 0, "errors": 0}
+    
+    def _get_pool(self):
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self.mp_context,
+                initializer=_init_inference_worker,
+                initargs=(self.factory,),
+            )
+        return self._pool
+    
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._batcher is None or self._batcher.done():
+            # Queue, semaphore and futures belong to the loop that created them
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._inflight.clear()
+            self._batcher = loop.create_task(self._run_batcher())
+    
+    async def analyze(self, image_bytes: bytes) -> Dict[str, Any]:
+        self._ensure_running()
+        self.stats["images"] += 1
+        key = hashlib.sha256(image_bytes).hexdigest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+            return dict(cached, cached=True)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.stats["deduped"] += 1
+        else:
+            fut = self._loop.create_future()
+            self._inflight[key] = fut
+            self._queue.put_nowait((key, image_bytes, fut, time.perf_counter()))
+        return dict(await asyncio.shield(fut))
+    
+    async def analyze_many(self, images: List[bytes]) -> List[Dict[str, Any]]:
+        """All images queued at once -> they share batches"""
+        return list(await asyncio.gather(*(self.analyze(image) for image in images)))
+    
+    async def _run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free worker first: meanwhile the queue keeps filling
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+    
+    async def _dispatch(self, batch):
+        started = time.perf_counter()
+        model_seconds = None
+        try:
+            results, model_seconds = await asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), _infer_batch, [item[1] for item in batch])
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Damage inference batch failed: {type(e).__name__}: {e}")
+            if "BrokenProcessPool" in type(e).__name__:
+                self.shutdown()
+            results = [{"ok": False, "error": f"Inference failed: {e}"} for _ in batch]
+        finally:
+            self._slots.release()
+        finished = time.perf_counter()
         
-        return {
-            "ok": True,
-            "has_damage": has_damage,
-            "damage_type": damage_type if has_damage else None,
-            "confidence": round(confidence, 4),
-            "confidence_percent": round(confidence * 100, 2),
-            "verdict": verdict,
-            "all_predictions": [
-                {
-                    "type": p['label'],
-                    "confidence": round(p['score'], 4),
-                    "confidence_percent": round(p['score'] * 100, 2)
-                }
-                for p in predictions[:5]  # Top 5
-            ]
-        }
+        self.stats["batches"] += 1
+        self._batches.append((
+            len(batch),
+            (finished - started) * 1000,
+            model_seconds * 1000 if model_seconds is not None else None,
+            (started - min(item[3] for item in batch)) * 1000,
+        ))
+        for (key, _, fut, _), result in zip(batch, results):
+            self._inflight.pop(key, None)
+            if result.get("ok"):
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            if not fut.done():
+                fut.set_result(result)
+    
+    def warm_up(self):
+        """Start the worker processes (and load the model) without waiting"""
+        try:
+            self._get_pool().submit(_worker_ready)
+        except Exception as e:
+            logger.debug(f"⚠️ Could not start damage inference workers: {e}")
+    
+    def shutdown(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        batches = list(self._batches)
         
-    except Exception as e:
-        logger.error(f"Error analyzing image: {e}")
-        import traceback
-        traceback.print_exc()
+        def summary(values):
+            values = sorted(v for v in values if v is not None)
+            if not values:
+                return None
+            return {
+                "avg": round(sum(values) / len(values), 1),
+                "p50": round(values[len(values) // 2], 1),
+                "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+                "max": round(values[-1], 1),
+            }
         
         return {
-            "ok": False,
-            "error": str(e)
+            **self.stats,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "inflight": len(self._inflight),
+            "cached_results": len(self._cache),
+            "workers": self.workers,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "recent_batches": len(batches),
+            "avg_batch_size": round(sum(b[0] for b in batches) / len(batches), 2) if batches else None,
+            "batch_ms": summary(b[1] for b in batches),
+            "model_ms": summary(b[2] for b in batches),
+            "queue_wait_ms": summary(b[3] for b in batches),
+            "last_batch": dict(zip(("images", "batch_ms", "model_ms", "queue_wait_ms"), batches[-1])) if batches else None,
         }
 
 
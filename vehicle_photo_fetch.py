@@ -0,0 +1,381 @@
+"""
+Download das fotos dos veículos (CDN do CarJet): concorrência limitada, pedidos
+condicionais e hash do conteúdo
+
+fetch_all() descarrega cada URL uma só vez (vários veículos partilham a mesma foto),
+no máximo `concurrency` pedidos em simultâneo num httpx.AsyncClient partilhado.
+Com os validadores da última vez (ETag / Last-Modified) o pedido é condicional e um
+304 não transfere nada. Cada foto descarregada leva o sha256 do conteúdo: quem grava
+compara-o com o da foto guardada e não volta a escrever a mesma imagem.
+
+Sem dependências da app (o httpx.AsyncClient vem de quem chama).
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# Mapeamento manual para veículos sem fotos no histórico de scraping (car_images.db)
+CARJET_IMAGE_URLS = {
+    # MINI / B1 / B2
+    'fiat 500 cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L154.jpg',
+    'fiat 500': 'https://www.carjet.com/cdn/img/cars/M/car_C25.jpg',
+    'fiat 500x': 'https://www.carjet.com/cdn/img/cars/M/car_A112.jpg',
+    'fiat 500x auto': 'https://www.carjet.com/cdn/img/cars/M/car_A112.jpg',
+    'fiat 500l': 'https://www.carjet.com/cdn/img/cars/M/car_C43.jpg',
+    'fiat panda': 'https://www.carjet.com/cdn/img/cars/M/car_C30.jpg',
+    'citroen c1': 'https://www.carjet.com/cdn/img/cars/M/car_C96.jpg',
+    'citroën c1': 'https://www.carjet.com/cdn/img/cars/M/car_C96.jpg',
+    'toyota aygo': 'https://www.carjet.com/cdn/img/cars/M/car_C29.jpg',
+    'toyota aygo x': 'https://www.carjet.com/cdn/img/cars/M/car_F408.jpg',
+    'volkswagen up': 'https://www.carjet.com/cdn/img/cars/M/car_C66.jpg',
+    'vw up': 'https://www.carjet.com/cdn/img/cars/M/car_C66.jpg',
+    'peugeot 108': 'https://www.carjet.com/cdn/img/cars/M/car_C15.jpg',
+    'peugeot 108 cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L41.jpg',
+    'hyundai i10': 'https://www.carjet.com/cdn/img/cars/M/car_C32.jpg',
+    'kia picanto': 'https://www.carjet.com/cdn/img/cars/M/car_C59.jpg',
+    'opel adam': 'https://www.carjet.com/cdn/img/cars/M/car_C50.jpg',
+    'mitsubishi space star': 'https://www.carjet.com/cdn/img/cars/M/car_C190.jpg',
+    'mitsubishi spacestar': 'https://www.carjet.com/cdn/img/cars/M/car_C190.jpg',
+    'nissan micra': 'https://www.carjet.com/cdn/img/cars/M/car_C13.jpg',
+    'renault twingo': 'https://www.carjet.com/cdn/img/cars/M/car_C61.jpg',
+    'dacia sandero': 'https://www.carjet.com/cdn/img/cars/M/car_C75.jpg',
+    'skoda scala': 'https://www.carjet.com/cdn/img/cars/M/car_C166.jpg',
+    
+    # ECONOMY / D / E2
+    'renault clio': 'https://www.carjet.com/cdn/img/cars/M/car_C04.jpg',
+    'renault clio sw': 'https://www.carjet.com/cdn/img/cars/M/car_C54.jpg',
+    'peugeot 208': 'https://www.carjet.com/cdn/img/cars/M/car_C60.jpg',
+    'ford fiesta': 'https://www.carjet.com/cdn/img/cars/M/car_C17.jpg',
+    'ford ka': 'https://www.carjet.com/cdn/img/cars/M/car_N07.jpg',
+    'volkswagen polo': 'https://www.carjet.com/cdn/img/cars/M/car_C27.jpg',
+    'vw polo': 'https://www.carjet.com/cdn/img/cars/M/car_C27.jpg',
+    'hyundai i20': 'https://www.carjet.com/cdn/img/cars/M/car_C52.jpg',
+    'seat ibiza': 'https://www.carjet.com/cdn/img/cars/M/car_C01.jpg',
+    'seat ibiza auto': 'https://www.carjet.com/cdn/img/cars/M/car_C01.jpg',
+    'citroen c3': 'https://www.carjet.com/cdn/img/cars/M/car_C06.jpg',
+    'citroën c3': 'https://www.carjet.com/cdn/img/cars/M/car_C06.jpg',
+    'citroen c4 cactus': 'https://www.carjet.com/cdn/img/cars/M/car_C51.jpg',
+    'citroën c4 cactus': 'https://www.carjet.com/cdn/img/cars/M/car_C51.jpg',
+    'opel corsa': 'https://www.carjet.com/cdn/img/cars/M/car_A03.jpg',
+    'opel corsa auto': 'https://www.carjet.com/cdn/img/cars/M/car_A03.jpg',
+    'toyota yaris': 'https://www.carjet.com/cdn/img/cars/M/car_C64.jpg',
+    
+    # COMPACT / F
+    'volkswagen golf': 'https://www.carjet.com/cdn/img/cars/M/car_F12.jpg',
+    'vw golf': 'https://www.carjet.com/cdn/img/cars/M/car_F12.jpg',
+    'audi a1': 'https://www.carjet.com/cdn/img/cars/M/car_C42.jpg',
+    'ford focus': 'https://www.carjet.com/cdn/img/cars/M/car_F02.jpg',
+    'renault megane': 'https://www.carjet.com/cdn/img/cars/M/car_F05.jpg',
+    'renault mégane': 'https://www.carjet.com/cdn/img/cars/M/car_F05.jpg',
+    'peugeot 308': 'https://www.carjet.com/cdn/img/cars/M/car_F22.jpg',
+    'hyundai i30': 'https://www.carjet.com/cdn/img/cars/M/car_C41.jpg',
+    'kia ceed': 'https://www.carjet.com/cdn/img/cars/M/car_C21.jpg',
+    'kia ceed auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1023.jpg',
+    'seat leon': 'https://www.carjet.com/cdn/img/cars/M/car_F39.jpg',
+    'seat león': 'https://www.carjet.com/cdn/img/cars/M/car_F39.jpg',
+    'toyota corolla auto': 'https://www.carjet.com/cdn/img/cars/M/car_A623.jpg',
+    'opel astra': 'https://www.carjet.com/cdn/img/cars/M/car_F73.jpg',
+    'citroen c4': 'https://www.carjet.com/cdn/img/cars/M/car_A17.jpg',
+    'citroën c4': 'https://www.carjet.com/cdn/img/cars/M/car_A17.jpg',
+    'peugeot 508': 'https://www.carjet.com/cdn/img/cars/M/car_F65.jpg',
+    
+    # SUV / F / L1
+    'nissan juke': 'https://www.carjet.com/cdn/img/cars/M/car_F29.jpg',
+    'peugeot 2008': 'https://www.carjet.com/cdn/img/cars/M/car_F91.jpg',
+    'peugeot 3008': 'https://www.carjet.com/cdn/img/cars/M/car_A132.jpg',
+    'peugeot 3008 auto': 'https://www.carjet.com/cdn/img/cars/M/car_A132.jpg',
+    'renault captur': 'https://www.carjet.com/cdn/img/cars/M/car_F44.jpg',
+    'volkswagen t-cross': 'https://www.carjet.com/cdn/img/cars/M/car_F252.jpg',
+    'vw t-cross': 'https://www.carjet.com/cdn/img/cars/M/car_F252.jpg',
+    'volkswagen tcross': 'https://www.carjet.com/cdn/img/cars/M/car_F252.jpg',
+    'ford kuga': 'https://www.carjet.com/cdn/img/cars/M/car_F41.jpg',
+    'kia stonic': 'https://www.carjet.com/cdn/img/cars/M/car_F119.jpg',
+    'citroen c3 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A782.jpg',
+    'citroën c3 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A782.jpg',
+    'citroen c5 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
+    'citroën c5 aircross': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
+    'citroen c5 aircross auto': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
+    'citroën c5 aircross auto': 'https://www.carjet.com/cdn/img/cars/M/car_A640.jpg',
+    'jeep avenger': 'https://www.carjet.com/cdn/img/cars/M/car_L164.jpg',
+    'jeep renegade': 'https://www.carjet.com/cdn/img/cars/M/car_A222.jpg',
+    'jeep renegade auto': 'https://www.carjet.com/cdn/img/cars/M/car_A222.jpg',
+    'volkswagen taigo': 'https://www.carjet.com/cdn/img/cars/M/car_F352.jpg',
+    'vw taigo': 'https://www.carjet.com/cdn/img/cars/M/car_F352.jpg',
+    'hyundai kauai': 'https://www.carjet.com/cdn/img/cars/M/car_F44.jpg',
+    'hyundai kauaí': 'https://www.carjet.com/cdn/img/cars/M/car_F44.jpg',
+    'mitsubishi asx': 'https://www.carjet.com/cdn/img/cars/M/car_F178.jpg',
+    'hyundai kona': 'https://www.carjet.com/cdn/img/cars/M/car_F191.jpg',
+    'toyota c-hr': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
+    'toyota chr': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
+    'toyota c-hr auto': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
+    'toyota chr auto': 'https://www.carjet.com/cdn/img/cars/M/car_A301.jpg',
+    'ford ecosport': 'https://www.carjet.com/cdn/img/cars/M/car_A606.jpg',
+    'ford eco sport': 'https://www.carjet.com/cdn/img/cars/M/car_A606.jpg',
+    'ford ecosport auto': 'https://www.carjet.com/cdn/img/cars/M/car_A606.jpg',
+    'opel crossland x': 'https://www.carjet.com/cdn/img/cars/M/car_A444.jpg',
+    'opel crossland x auto': 'https://www.carjet.com/cdn/img/cars/M/car_A444.jpg',
+    'volkswagen tiguan': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
+    'vw tiguan': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
+    'volkswagen tiguan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
+    'vw tiguan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A830.jpg',
+    'skoda karoq': 'https://www.carjet.com/cdn/img/cars/M/car_A822.jpg',
+    'skoda karoq auto': 'https://www.carjet.com/cdn/img/cars/M/car_A822.jpg',
+    'kia sportage': 'https://www.carjet.com/cdn/img/cars/M/car_F43.jpg',
+    'nissan qashqai': 'https://www.carjet.com/cdn/img/cars/M/car_F24.jpg',
+    'skoda kamiq': 'https://www.carjet.com/cdn/img/cars/M/car_F310.jpg',
+    'hyundai tucson': 'https://www.carjet.com/cdn/img/cars/M/car_F310.jpg',
+    'renault austral': 'https://www.carjet.com/cdn/img/cars/M/car_F430.jpg',
+    'seat ateca': 'https://www.carjet.com/cdn/img/cars/M/car_F154.jpg',
+    'seat arona': 'https://www.carjet.com/cdn/img/cars/M/car_F194.jpg',
+    'seat arona auto': 'https://www.carjet.com/cdn/img/cars/M/car_F194.jpg',
+    'ford puma': 'https://www.carjet.com/cdn/img/cars/M/car_A999.jpg',
+    'ford puma auto': 'https://www.carjet.com/cdn/img/cars/M/car_A999.jpg',
+    'mazda cx-3': 'https://www.carjet.com/cdn/img/cars/M/car_F179.jpg',
+    'mazda cx 3': 'https://www.carjet.com/cdn/img/cars/M/car_F179.jpg',
+    'renault arkana': 'https://www.carjet.com/cdn/img/cars/M/car_A1159.jpg',
+    'renault arkana auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1159.jpg',
+    'toyota rav 4': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
+    'toyota rav4': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
+    'toyota rav 4 4x4': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
+    'toyota rav 4 auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1000.jpg',
+    'toyota hilux': 'https://www.carjet.com/cdn/img/cars/M/car_F326.jpg',
+    'toyota hilux 4x4': 'https://www.carjet.com/cdn/img/cars/M/car_F326.jpg',
+    
+    # PREMIUM / G
+    'mini cooper countryman': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
+    'miny cooper countryman': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
+    'mini countryman': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
+    'mini cooper countryman auto': 'https://www.carjet.com/cdn/img/cars/M/car_F209.jpg',
+    'mini cooper cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L118.jpg',
+    'mini one cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L118.jpg',
+    'volkswagen beetle cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L44.jpg',
+    'vw beetle cabrio': 'https://www.carjet.com/cdn/img/cars/M/car_L44.jpg',
+    'cupra formentor': 'https://www.carjet.com/cdn/img/cars/M/car_A1185.jpg',
+    'cupra formentor auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1185.jpg',
+    'ds 4': 'https://www.carjet.com/cdn/img/cars/M/car_A1637.jpg',
+    'ds 4 auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1637.jpg',
+    
+    # STATION WAGON / J2 / L2
+    'peugeot 308 sw': 'https://www.carjet.com/cdn/img/cars/M/car_S06.jpg',
+    'peugeot 308 sw auto': 'https://www.carjet.com/cdn/img/cars/M/car_S06.jpg',
+    'opel astra sw': 'https://www.carjet.com/cdn/img/cars/M/car_S10.jpg',
+    'cupra leon sw': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
+    'cupra leon st': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
+    'cupra leon estate': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
+    'cupra leon sport tourer': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
+    'cupra leon sw auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1426.jpg',
+    'toyota corolla sw': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
+    'toyota corolla touring sports': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
+    'toyota corolla estate': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
+    'toyota corolla sw auto': 'https://www.carjet.com/cdn/img/cars/M/car_A590.jpg',
+    'skoda octavia': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
+    'skoda octavia sw': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
+    'skoda octavia combi': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
+    'skoda octavia estate': 'https://www.carjet.com/cdn/img/cars/M/car_I12.jpg',
+    'skoda fabia sw': 'https://www.carjet.com/cdn/img/cars/M/car_S34.jpg',
+    'skoda fabia combi': 'https://www.carjet.com/cdn/img/cars/M/car_S34.jpg',
+    'skoda fabia estate': 'https://www.carjet.com/cdn/img/cars/M/car_S34.jpg',
+    'volkswagen passat': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
+    'vw passat': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
+    'volkswagen passat variant': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
+    'volkswagen passat estate': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
+    'volkswagen passat sw': 'https://www.carjet.com/cdn/img/cars/M/car_I11.jpg',
+    'fiat tipo sw': 'https://www.carjet.com/cdn/img/cars/M/car_F72.jpg',
+    'fiat tipo estate': 'https://www.carjet.com/cdn/img/cars/M/car_F72.jpg',
+    'seat leon sw': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
+    'seat leon st': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
+    'seat leon estate': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
+    'seat leon sport tourer': 'https://www.carjet.com/cdn/img/cars/M/car_F46.jpg',
+    
+    # 7 SEATER / M1 / M2
+    'dacia lodgy': 'https://www.carjet.com/cdn/img/cars/M/car_M117.jpg',
+    'dacia jogger': 'https://www.carjet.com/cdn/img/cars/M/car_M162.jpg',
+    'opel zafira': 'https://www.carjet.com/cdn/img/cars/M/car_M05.jpg',
+    'peugeot 5008': 'https://www.carjet.com/cdn/img/cars/M/car_M27.jpg',
+    'renault grand scenic': 'https://www.carjet.com/cdn/img/cars/M/car_M15.jpg',
+    'renault grand scenic auto': 'https://www.carjet.com/cdn/img/cars/M/car_M15.jpg',
+    'citroen grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
+    'citroën grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
+    'citroen c4 grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
+    'citroën c4 grand picasso': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
+    'citroen c4 grand picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
+    'citroën c4 grand picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A219.jpg',
+    'citroen c4 picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A522.jpg',
+    'citroën c4 picasso auto': 'https://www.carjet.com/cdn/img/cars/M/car_A522.jpg',
+    'citroen c4 grand spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A1430.jpg',
+    'citroën c4 grand spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A1430.jpg',
+    'citroen c4 grand spacetourer auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1430.jpg',
+    'volkswagen caddy': 'https://www.carjet.com/cdn/img/cars/M/car_A295.jpg',
+    'vw caddy': 'https://www.carjet.com/cdn/img/cars/M/car_A295.jpg',
+    'volkswagen caddy auto': 'https://www.carjet.com/cdn/img/cars/M/car_A295.jpg',
+    'peugeot rifter': 'https://www.carjet.com/cdn/img/cars/M/car_M124.jpg',
+    'peugeot rifter auto': 'https://www.carjet.com/cdn/img/cars/M/car_M124.jpg',
+    'mercedes glb': 'https://www.carjet.com/cdn/img/cars/M/car_GZ399.jpg',
+    'mercedes glb auto': 'https://www.carjet.com/cdn/img/cars/M/car_GZ399.jpg',
+    
+    # 9 SEATER / N
+    'ford tourneo': 'https://www.carjet.com/cdn/img/cars/M/car_M44.jpg',
+    'ford transit': 'https://www.carjet.com/cdn/img/cars/M/car_M02.jpg',
+    'ford galaxy': 'https://www.carjet.com/cdn/img/cars/M/car_M03.jpg',
+    'volkswagen sharan': 'https://www.carjet.com/cdn/img/cars/M/car_M56.jpg',
+    'vw sharan': 'https://www.carjet.com/cdn/img/cars/M/car_M56.jpg',
+    'volkswagen multivan': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
+    'vw multivan': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
+    'volkswagen multivan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
+    'vw multivan auto': 'https://www.carjet.com/cdn/img/cars/M/car_A406.jpg',
+    'citroen spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A261.jpg',
+    'citroën spacetourer': 'https://www.carjet.com/cdn/img/cars/M/car_A261.jpg',
+    'citroen spacetourer auto': 'https://www.carjet.com/cdn/img/cars/M/car_A261.jpg',
+    'renault trafic': 'https://www.carjet.com/cdn/img/cars/M/car_A581.jpg',
+    'renault trafic auto': 'https://www.carjet.com/cdn/img/cars/M/car_A581.jpg',
+    'peugeot traveller': 'https://www.carjet.com/cdn/img/cars/M/car_M86.jpg',
+    'volkswagen transporter': 'https://www.carjet.com/cdn/img/cars/M/car_M08.jpg',
+    'vw transporter': 'https://www.carjet.com/cdn/img/cars/M/car_M08.jpg',
+    'mercedes vito': 'https://www.carjet.com/cdn/img/cars/M/car_A230.jpg',
+    'mercedes benz vito': 'https://www.carjet.com/cdn/img/cars/M/car_A230.jpg',
+    'mercedes vito auto': 'https://www.carjet.com/cdn/img/cars/M/car_A230.jpg',
+    'volkswagen caravelle': 'https://www.carjet.com/cdn/img/cars/M/car_M63.jpg',
+    'vw caravelle': 'https://www.carjet.com/cdn/img/cars/M/car_M63.jpg',
+    'mercedes v class': 'https://www.carjet.com/cdn/img/cars/M/car_A1336.jpg',
+    'mercedes benz v class': 'https://www.carjet.com/cdn/img/cars/M/car_A1336.jpg',
+    'mercedes v class auto': 'https://www.carjet.com/cdn/img/cars/M/car_A1336.jpg',
+    'fiat talento': 'https://www.carjet.com/cdn/img/cars/M/car_M49.jpg',
+    'opel vivaro': 'https://www.carjet.com/cdn/img/cars/M/car_M34.jpg',
+    'toyota proace': 'https://www.carjet.com/cdn/img/cars/M/car_M136.jpg',
+}
+
+# Limpeza dos model_key do car_images.db para as chaves do VEHICLES
+_MODEL_KEY_CLEANUP = (
+    re.compile(r'\s+(ou\s*similar|or\s*similar).*$', re.IGNORECASE),
+    re.compile(r'\s*\|\s*.*$'),
+    re.compile(r'\s+(pequeno|médio|medio|grande|compacto|economico|econômico).*$', re.IGNORECASE),
+)
+_SPACES_RX = re.compile(r'\s+')
+
+
+def clean_model_key(model_key: str) -> str:
+    clean = model_key.lower().strip()
+    for rx in _MODEL_KEY_CLEANUP:
+        clean = rx.sub('', clean)
+    return _SPACES_RX.sub(' ', clean).strip()
+
+
+# Validadores HTTP guardados de um URL: (etag, last_modified)
+Validators = Tuple[Optional[str], Optional[str]]
+
+OK, NOT_MODIFIED, ERROR = "ok", "not_modified", "error"
+
+
+class Fetch:
+    """Resultado do download de um URL"""
+    __slots__ = ("url", "status", "data", "content_type", "etag", "last_modified", "sha256", "error", "seconds")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.status = ERROR
+        self.data: Optional[bytes] = None
+        self.content_type: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.sha256: Optional[str] = None
+        self.error: Optional[str] = None
+        self.seconds = 0.0
+
+
+class Throughput:
+    """Contadores de um run (pedidos, bytes, tempo) para o relatório"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.downloaded = 0
+        self.not_modified = 0
+        self.failed = 0
+        self.bytes = 0
+        self.request_seconds = 0.0
+        self.by_hash: Dict[str, int] = {}  # sha256 -> URLs com esse conteúdo
+
+    def add(self, fetch: Fetch):
+        self.requests += 1
+        self.request_seconds += fetch.seconds
+        if fetch.status == OK:
+            self.downloaded += 1
+            self.bytes += len(fetch.data)
+            self.by_hash[fetch.sha256] = self.by_hash.get(fetch.sha256, 0) + 1
+        elif fetch.status == NOT_MODIFIED:
+            self.not_modified += 1
+        else:
+            self.failed += 1
+
+    def report(self) -> Dict[str, object]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "downloaded": self.downloaded,
+            "not_modified": self.not_modified,
+            "failed": self.failed,
+            "unique_images": len(self.by_hash),
+            "duplicate_images": sum(self.by_hash.values()) - len(self.by_hash),
+            "bytes": self.bytes,
+            "elapsed_seconds": round(elapsed, 2),
+            "requests_per_second": round(self.requests / elapsed, 2) if elapsed > 0 else None,
+            "mb_per_second": round(self.bytes / elapsed / (1024 * 1024), 3) if elapsed > 0 else None,
+            "avg_request_ms": round(self.request_seconds * 1000 / self.requests, 1) if self.requests else None,
+        }
+
+
+async def fetch_one(client, url: str, validators: Optional[Validators] = None) -> Fetch:
+    fetch = Fetch(url)
+    headers = {}
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    started = time.perf_counter()
+    try:
+        response = await client.get(url, headers=headers)
+        if response.status_code == 304 and headers:
+            fetch.status = NOT_MODIFIED
+            fetch.etag, fetch.last_modified = validators
+        elif response.status_code == 200 and response.content:
+            fetch.status = OK
+            fetch.data = response.content
+            fetch.content_type = response.headers.get("content-type", "image/jpeg")
+            fetch.etag = response.headers.get("etag")
+            fetch.last_modified = response.headers.get("last-modified")
+            fetch.sha256 = hashlib.sha256(fetch.data).hexdigest()
+        else:
+            fetch.error = f"HTTP {response.status_code}"
+    except Exception as e:
+        fetch.error = str(e) or type(e).__name__
+    fetch.seconds = time.perf_counter() - started
+    return fetch
+
+
+async def fetch_all(client, urls: Dict[str, Optional[Validators]], concurrency: int = 8,
+                    on_result: Optional[Callable[[Fetch], None]] = None,
+                    throughput: Optional[Throughput] = None) -> Dict[str, Fetch]:
+    """
+    urls: url -> validadores (None = pedido normal)
+    on_result(fetch) é chamado à medida que cada URL termina (progresso)
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(url: str, validators: Optional[Validators]) -> Fetch:
+        async with semaphore:
+            fetch = await fetch_one(client, url, validators)
+        if throughput is not None:
+            throughput.add(fetch)
+        if on_result is not None:
+            on_result(fetch)
+        return fetch
+
+    results = await asyncio.gather(*(run(url, validators) for url, validators in urls.items()))
+    return {fetch.url: fetch for fetch in results}